@@ -2773,7 +2773,9 @@ class Agent:
                     answer = await _collect_stream_to_string(stream_obj)
                     output_tokens = get_tokens(answer)
                     self.auth.increase_token_counts(
-                        input_tokens=input_tokens, output_tokens=output_tokens
+                        input_tokens=input_tokens,
+                        output_tokens=output_tokens,
+                        agent_id=self.agent_id,
                     )
 
                     answer = str(answer).replace("\\_", "_")
@@ -2833,6 +2835,47 @@ class Agent:
         )
         return "<answer>Unable to process request.</answer>"
 
+    async def batch_inference(self, prompts: list, use_smartest: bool = False):
+        """
+        Send a group of prompts to the provider's native batch API.
+
+        Only providers that implement ``batch_inference(prompts, use_smartest)``
+        support this. Returns None when the selected provider has no batch
+        support, so callers can fall back to one request per prompt.
+        """
+        if not prompts:
+            return []
+
+        self.auth.check_billing_balance()
+
+        input_tokens = [get_tokens(prompt) for prompt in prompts]
+        provider = self.ai_provider_manager.get_provider_for_service(
+            service="llm",
+            tokens=max(input_tokens),
+            use_smartest=use_smartest,
+        )
+        if provider is None or not hasattr(provider, "batch_inference"):
+            return None
+
+        provider_name = provider.__class__.__name__.replace("aiprovider_", "")
+        try:
+            answers = await provider.batch_inference(
+                prompts=prompts, use_smartest=use_smartest
+            )
+        except Exception as e:
+            logging.error(
+                f"Error in batch inference with provider '{provider_name}': {e}"
+            )
+            self.ai_provider_manager.mark_provider_failed(provider_name)
+            raise
+        answers = [str(answer).replace("\\_", "_") for answer in answers]
+        self.auth.increase_token_counts(
+            input_tokens=sum(input_tokens),
+            output_tokens=sum(get_tokens(answer) for answer in answers),
+            agent_id=self.agent_id,
+        )
+        return answers
+
     async def vision_inference(
         self, prompt: str, images: list = [], use_smartest: bool = False
     ):
@@ -2866,7 +2909,9 @@ class Agent:
             answer = await _collect_stream_to_string(stream_obj)
             output_tokens = get_tokens(answer)
             self.auth.increase_token_counts(
-                input_tokens=input_tokens, output_tokens=output_tokens
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                agent_id=self.agent_id,
             )
 
             answer = str(answer).replace("\\_", "_")
@@ -0,0 +1,500 @@
+"""
+AuthContext - One authentication and authorization lookup per request
+
+A protected route used to authenticate several times over. `verify_api_key`
+ran in the threadpool, opened a session for the TokenBlacklist check and
+loaded the user on a cache miss. Then every `require_scope` built a fresh
+MagicalAuth, decoded the JWT again, queried the database to see if the user
+is a super admin and resolved the user's company and scopes.
+
+The resolver here does all of that once:
+
+1. The token is decoded once per request.
+2. Revocation is checked against the set of revoked token digests. The set
+   is built from TokenBlacklist, shared through SharedCache and kept
+   briefly in each worker, so the check usually costs no I/O at all.
+3. The user, the user's company, whether they are a super admin and their
+   scopes are loaded in one session. The result is cached as a whole in
+   SharedCache for a few seconds.
+4. The context is stored on `request.state.auth_context`. `require_scope`,
+   `require_all_scopes`, `verify_api_key` and endpoint code all reuse it.
+
+`get_auth_context` is an async FastAPI dependency. It answers from the
+caches on the event loop and only moves to the threadpool when the database
+is needed.
+
+    @app.get("/v1/things", dependencies=[Depends(require_scope("things:read"))])
+    async def things(context: AuthContext = Depends(get_auth_context)):
+        ...
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional, Set
+
+import jwt
+from fastapi import Header, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+SOURCE_JWT = "jwt"
+SOURCE_PAT = "pat"
+SOURCE_API_KEY = "api_key"
+
+# How long a resolved user, company and scopes are reused across requests
+AUTH_CONTEXT_CACHE_TTL = int(os.getenv("AUTH_CONTEXT_CACHE_TTL", "10"))
+# How long the shared revoked token set lives before it is rebuilt from the DB
+REVOKED_TOKENS_CACHE_TTL = int(os.getenv("REVOKED_TOKENS_CACHE_TTL", "60"))
+# How long each worker trusts its own copy of the revoked token set
+REVOKED_TOKENS_LOCAL_TTL = float(os.getenv("REVOKED_TOKENS_LOCAL_TTL", "5"))
+# Matches the leeway used everywhere a JWT is decoded
+JWT_LEEWAY = timedelta(hours=5)
+
+REVOKED_TOKENS_KEY = "revoked_tokens"
+_USER_DATETIME_FIELDS = {"created_at", "updated_at", "tos_accepted_at"}
+
+
+def normalize_token(authorization) -> str:
+    """Strip the Bearer prefix and URL quoting from an authorization value"""
+    if not authorization:
+        return ""
+    token = str(authorization)
+    if token.startswith("Bearer ") or token.startswith("bearer "):
+        token = token.replace("Bearer ", "").replace("bearer ", "")
+    if "%" in token:
+        token = urllib.parse.unquote(token)
+    if token == "None":
+        return ""
+    return token
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def serialize_user(user: dict) -> dict:
+    """Convert a user dict to a JSON-serializable one (datetimes, UUIDs)"""
+    result = {}
+    for key, value in user.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif not isinstance(value, (str, int, float, bool, list, dict, type(None))):
+            value = str(value)
+        result[key] = value
+    return result
+
+
+def deserialize_user(cached: dict) -> dict:
+    """Convert a cached user dict back, restoring datetime fields"""
+    result = {}
+    for key, value in cached.items():
+        if key in _USER_DATETIME_FIELDS and isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+        result[key] = value
+    return result
+
+
+def scope_matches(scope: str, user_scopes: Iterable[str]) -> bool:
+    """Return True when a scope is granted by exact or wildcard match."""
+    if "*" in user_scopes:
+        return True
+
+    if scope in user_scopes:
+        return True
+
+    parts = scope.split(":")
+    if parts[0] == "ext" and len(parts) >= 3:
+        ext_name = parts[1]
+
+        if "ext:*" in user_scopes:
+            return True
+
+        if len(parts) == 3:
+            action = parts[2]
+            if f"ext:*:{action}" in user_scopes:
+                return True
+            if f"ext:{ext_name}:*" in user_scopes:
+                return True
+
+        elif len(parts) == 4:
+            feature = parts[2]
+            action = parts[3]
+            if f"ext:*:{feature}:{action}" in user_scopes:
+                return True
+            if f"ext:*:*:{action}" in user_scopes:
+                return True
+            if f"ext:{ext_name}:*" in user_scopes:
+                return True
+            if f"ext:{ext_name}:{feature}:*" in user_scopes:
+                return True
+            if f"ext:{ext_name}:*:{action}" in user_scopes:
+                return True
+            if action == "execute" and f"ext:{ext_name}:execute" in user_scopes:
+                return True
+            if action == "read" and f"ext:{ext_name}:read" in user_scopes:
+                return True
+
+    if len(parts) >= 2:
+        resource = parts[0]
+        if f"{resource}:*" in user_scopes:
+            return True
+
+    return False
+
+
+@dataclass
+class AuthContext:
+    """Who is calling and what they may do, resolved once per request"""
+
+    token: str
+    source: str
+    user: dict
+    user_id: str
+    email: Optional[str] = None
+    company_id: Optional[str] = None
+    is_super_admin: bool = False
+    # Scopes from the user's roles in company_id
+    scopes: Set[str] = field(default_factory=set)
+    # Set for personal access tokens, which carry their own scopes
+    pat_scopes: Optional[Set[str]] = None
+    pat_agent_ids: Optional[Set[str]] = None
+    pat_company_ids: Optional[Set[str]] = None
+
+    def has_scope(self, scope: str) -> bool:
+        if self.pat_scopes is not None:
+            return scope_matches(scope, self.pat_scopes)
+        if self.is_super_admin:
+            return True
+        return scope_matches(scope, self.scopes)
+
+    def has_any_scope(self, scopes: Iterable[str]) -> bool:
+        return any(self.has_scope(scope) for scope in scopes)
+
+    def has_all_scopes(self, scopes: Iterable[str]) -> bool:
+        return all(self.has_scope(scope) for scope in scopes)
+
+    def user_dict(self) -> dict:
+        """The user dict verify_api_key returns"""
+        user = dict(self.user)
+        if self.pat_scopes is not None:
+            user["_pat_scopes"] = sorted(self.pat_scopes)
+            user["_pat_agent_ids"] = sorted(self.pat_agent_ids or ())
+            user["_pat_company_ids"] = sorted(self.pat_company_ids or ())
+        return user
+
+    def to_cache(self) -> dict:
+        def as_list(values):
+            return None if values is None else sorted(values)
+
+        return {
+            "source": self.source,
+            "user": serialize_user(self.user),
+            "user_id": self.user_id,
+            "email": self.email,
+            "company_id": self.company_id,
+            "is_super_admin": self.is_super_admin,
+            "scopes": sorted(self.scopes),
+            "pat_scopes": as_list(self.pat_scopes),
+            "pat_agent_ids": as_list(self.pat_agent_ids),
+            "pat_company_ids": as_list(self.pat_company_ids),
+        }
+
+    @classmethod
+    def from_cache(cls, token: str, data: dict) -> "AuthContext":
+        def as_set(values):
+            return None if values is None else set(values)
+
+        return cls(
+            token=token,
+            source=data["source"],
+            user=deserialize_user(data["user"]),
+            user_id=data["user_id"],
+            email=data.get("email"),
+            company_id=data.get("company_id"),
+            is_super_admin=data.get("is_super_admin", False),
+            scopes=set(data.get("scopes") or ()),
+            pat_scopes=as_set(data.get("pat_scopes")),
+            pat_agent_ids=as_set(data.get("pat_agent_ids")),
+            pat_company_ids=as_set(data.get("pat_company_ids")),
+        )
+
+
+def _load_revoked_digests() -> Iterable[str]:
+    from DB import TokenBlacklist, get_session
+
+    session = get_session()
+    try:
+        # Expired tokens still decode within the leeway, so keep them listed
+        rows = (
+            session.query(TokenBlacklist.token)
+            .filter(TokenBlacklist.expires_at >= datetime.now() - JWT_LEEWAY)
+            .all()
+        )
+        return [token_digest(row[0]) for row in rows]
+    finally:
+        session.close()
+
+
+class RevocationList:
+    """
+    Digests of revoked tokens. The set is built from TokenBlacklist, shared
+    through the cache and copied into each worker for `local_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        cache=None,
+        load: Optional[Callable[[], Iterable[str]]] = None,
+        ttl: int = REVOKED_TOKENS_CACHE_TTL,
+        local_ttl: float = REVOKED_TOKENS_LOCAL_TTL,
+    ):
+        self.cache = cache or shared_cache
+        self.load = load or _load_revoked_digests
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self._digests: Optional[Set[str]] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"cache_refreshes": 0, "db_loads": 0}
+
+    @property
+    def fresh(self) -> bool:
+        return self._digests is not None and time.monotonic() < self._expires
+
+    def contains(self, token: str, allow_db: bool = True) -> Optional[bool]:
+        """
+        Whether `token` is revoked. Returns None when the answer needs the
+        database and `allow_db` is False.
+        """
+        digests = self._current(allow_db)
+        if digests is None:
+            return None
+        return token_digest(token) in digests
+
+    def _current(self, allow_db: bool) -> Optional[Set[str]]:
+        if self.fresh:
+            return self._digests
+        cached = self.cache.get(REVOKED_TOKENS_KEY)
+        if cached is None:
+            if not allow_db:
+                return None
+            cached = list(self.load())
+            self.cache.set(REVOKED_TOKENS_KEY, cached, ttl=self.ttl)
+            self.stats["db_loads"] += 1
+        with self._lock:
+            self._digests = set(cached)
+            self._expires = time.monotonic() + self.local_ttl
+            self.stats["cache_refreshes"] += 1
+        return self._digests
+
+    def revoke(self, token: str):
+        """
+        Call after the token is committed to TokenBlacklist. This worker sees
+        the revocation at once, other workers within `local_ttl` seconds.
+        """
+        with self._lock:
+            if self._digests is not None:
+                self._digests.add(token_digest(token))
+        self.cache.delete(REVOKED_TOKENS_KEY)
+
+
+def _default_identify_pat(token: str) -> dict:
+    from MagicalAuth import validate_personal_access_token
+
+    return validate_personal_access_token(token)
+
+
+def _default_identify_api_key() -> dict:
+    from Globals import getenv
+    from MagicalAuth import get_user_id
+
+    email = getenv("DEFAULT_USER")
+    return {"user_id": str(get_user_id(email)), "email": email}
+
+
+def _default_load_context(token: str, source: str, identity: dict) -> AuthContext:
+    from MagicalAuth import load_auth_context
+
+    return load_auth_context(token, source, identity)
+
+
+class AuthContextResolver:
+    def __init__(
+        self,
+        cache=None,
+        revocations: Optional[RevocationList] = None,
+        load_context: Optional[Callable[[str, str, dict], AuthContext]] = None,
+        identify_pat: Optional[Callable[[str], dict]] = None,
+        ttl: int = AUTH_CONTEXT_CACHE_TTL,
+        secret: Optional[str] = None,
+    ):
+        self.cache = cache or shared_cache
+        self.revocations = revocations or RevocationList(cache=self.cache)
+        self.load_context = load_context or _default_load_context
+        self.identify_pat = identify_pat or _default_identify_pat
+        self.ttl = ttl
+        self.secret = secret
+        self.stats = {
+            "resolves": 0,
+            "cache_hits": 0,
+            "loads": 0,
+            "event_loop_resolves": 0,
+            "rejected": 0,
+        }
+
+    def _secret(self) -> str:
+        return (
+            self.secret if self.secret is not None else os.getenv("AGIXT_API_KEY", "")
+        )
+
+    def _reject(self, detail: str):
+        self.stats["rejected"] += 1
+        raise HTTPException(status_code=401, detail=detail)
+
+    def _decode(self, token: str) -> dict:
+        try:
+            claims = jwt.decode(
+                jwt=token,
+                key=self._secret(),
+                algorithms=["HS256"],
+                leeway=JWT_LEEWAY,
+            )
+        except jwt.PyJWTError:
+            self._reject("Invalid API Key")
+        if not claims.get("sub"):
+            self._reject("Invalid API Key")
+        return {"user_id": str(claims["sub"]), "email": claims.get("email")}
+
+    @staticmethod
+    def cache_key(user_id: str, token: str) -> str:
+        return f"auth_context:{user_id}:{token_digest(token)}"
+
+    def resolve_cached(self, authorization) -> Optional[AuthContext]:
+        """
+        Resolve a JWT from the caches alone, without the database. Returns
+        None when a lookup is needed; call `resolve` for that.
+        """
+        token = normalize_token(authorization)
+        secret = self._secret()
+        if not token or token.startswith("agixt_") or token == secret:
+            return None
+        identity = self._decode(token)
+        revoked = self.revocations.contains(token, allow_db=False)
+        if revoked is None:
+            return None
+        if revoked:
+            self._reject("Token has been revoked. Please log in again.")
+        cached = self.cache.get(self.cache_key(identity["user_id"], token))
+        if cached is None:
+            return None
+        self.stats["resolves"] += 1
+        self.stats["cache_hits"] += 1
+        self.stats["event_loop_resolves"] += 1
+        return AuthContext.from_cache(token, cached)
+
+    def resolve(self, authorization) -> AuthContext:
+        """Resolve the caller of `authorization`, raising 401 when invalid"""
+        token = normalize_token(authorization)
+        if not token:
+            self._reject("Authorization required")
+        secret = self._secret()
+        if token.startswith("agixt_"):
+            source = SOURCE_PAT
+            identity = self.identify_pat(token)
+            if not identity.get("valid"):
+                self._reject(identity.get("error", "Invalid personal access token"))
+        elif secret and token == secret:
+            source = SOURCE_API_KEY
+            identity = _default_identify_api_key()
+        else:
+            source = SOURCE_JWT
+            identity = self._decode(token)
+            if self.revocations.contains(token):
+                self._reject("Token has been revoked. Please log in again.")
+        self.stats["resolves"] += 1
+        key = self.cache_key(identity["user_id"], token)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return AuthContext.from_cache(token, cached)
+        context = self.load_context(token, source, identity)
+        self.stats["loads"] += 1
+        self.cache.set(key, context.to_cache(), ttl=self.ttl)
+        return context
+
+    def invalidate(self, user_id: Optional[str] = None, token: Optional[str] = None):
+        """Drop cached contexts of one token, one user or everyone"""
+        if user_id is not None and token is not None:
+            self.cache.delete(self.cache_key(user_id, token))
+        elif token is not None:
+            self.cache.delete_pattern(f"auth_context:*:{token_digest(token)}")
+        elif user_id is not None:
+            self.cache.delete_pattern(f"auth_context:{user_id}:*")
+        else:
+            self.cache.delete_pattern("auth_context:*")
+
+    def revoke(self, token: str):
+        """Call after `token` is written to TokenBlacklist"""
+        self.revocations.revoke(token)
+        self.invalidate(token=token)
+
+    def get_stats(self) -> dict:
+        resolves = self.stats["resolves"]
+        return {
+            **self.stats,
+            "cache_hit_rate": (
+                round(self.stats["cache_hits"] / resolves, 4) if resolves else 0.0
+            ),
+            "revocations": dict(self.revocations.stats),
+        }
+
+
+auth_context_resolver = AuthContextResolver()
+
+
+def _request_context(request: Optional[Request], token: str) -> Optional[AuthContext]:
+    if request is None:
+        return None
+    context = getattr(request.state, "auth_context", None)
+    if context is not None and context.token == token:
+        return context
+    return None
+
+
+def get_request_auth_context(request: Optional[Request], authorization) -> AuthContext:
+    """Synchronous variant of get_auth_context for threadpool dependencies"""
+    context = _request_context(request, normalize_token(authorization))
+    if context is None:
+        context = auth_context_resolver.resolve(authorization)
+        if request is not None:
+            request.state.auth_context = context
+    return context
+
+
+async def get_auth_context(
+    request: Request, authorization: str = Header(None)
+) -> AuthContext:
+    """
+    FastAPI dependency returning the caller's AuthContext. Resolved at most
+    once per request; the database is only touched on a cache miss.
+    """
+    context = _request_context(request, normalize_token(authorization))
+    if context is not None:
+        return context
+    context = auth_context_resolver.resolve_cached(authorization)
+    if context is None:
+        context = await run_in_threadpool(auth_context_resolver.resolve, authorization)
+    request.state.auth_context = context
+    return context
@@ -0,0 +1,318 @@
+"""
+BatchInference - Concurrent fan-out of many prompts
+
+`run_batch` sends a list of inputs through an async worker with a bounded
+number of requests in flight. Each item has its own timeout and retries, and
+results come back in input order with the error recorded on any item that
+failed, so one bad item never sinks the whole batch. Providers with a native
+batch API can take whole groups of items in one request instead.
+
+`BatchJobManager` runs batches in the background for the REST API. Job state
+lives in SharedCache so a job submitted to one worker can be polled or
+cancelled through any other.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv("BATCH_INFERENCE_CONCURRENCY", "5"))
+MAX_BATCH_CONCURRENCY = 50
+MAX_BATCH_ITEMS = int(os.getenv("BATCH_INFERENCE_MAX_ITEMS", "1000"))
+
+# Finished jobs (and their results) stay pollable for a day
+BATCH_JOB_TTL = 86400
+
+# Minimum seconds between progress writes for a running job
+PROGRESS_WRITE_INTERVAL = 1.0
+
+# Client errors that a retry cannot fix (bad request, auth, billing, missing)
+NON_RETRYABLE_STATUS_CODES = {400, 401, 402, 403, 404, 422}
+
+
+@dataclass
+class BatchItemResult:
+    index: int
+    input: Any
+    output: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _is_retryable(error: Exception) -> bool:
+    return getattr(error, "status_code", None) not in NON_RETRYABLE_STATUS_CODES
+
+
+def _describe(error: Exception) -> str:
+    detail = getattr(error, "detail", None)
+    return str(detail or error) or error.__class__.__name__
+
+
+async def run_batch(
+    inputs: List[Any],
+    worker: Callable[[Any], Awaitable[str]],
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    retry_backoff: float = 0.5,
+    batch_worker: Optional[
+        Callable[[List[Any]], Awaitable[Optional[List[str]]]]
+    ] = None,
+    provider_batch_size: int = 16,
+    on_result: Optional[Callable[[BatchItemResult], None]] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+) -> List[BatchItemResult]:
+    """
+    Run `worker` over `inputs` with at most `concurrency` calls in flight.
+
+    Args:
+        inputs: Items to process
+        worker: Coroutine function handling one item
+        concurrency: Maximum simultaneous worker (or batch_worker) calls
+        timeout: Per-attempt timeout in seconds
+        retries: Extra attempts for items that fail or time out
+        retry_backoff: Base delay for exponential backoff between attempts
+        batch_worker: Optional coroutine function taking a list of items and
+            returning outputs in the same order, or None when it cannot batch.
+            Items from a group it fails on are retried one at a time.
+        provider_batch_size: Items per batch_worker call
+        on_result: Callback run as each item finishes
+        should_cancel: Checked before each attempt; items not yet finished when
+            it returns True are marked cancelled
+
+    Returns:
+        One BatchItemResult per input, in input order
+    """
+    results = [BatchItemResult(index=i, input=item) for i, item in enumerate(inputs)]
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, MAX_BATCH_CONCURRENCY)))
+
+    def cancelled() -> bool:
+        return bool(should_cancel and should_cancel())
+
+    def finish(result: BatchItemResult):
+        if on_result:
+            try:
+                on_result(result)
+            except Exception as e:
+                logger.warning(f"Batch result callback failed: {e}")
+
+    async def run_item(result: BatchItemResult):
+        start = time.monotonic()
+        for attempt in range(retries + 1):
+            async with semaphore:
+                # Checked once a slot is free so queued items stop promptly
+                if cancelled():
+                    result.error = "Cancelled"
+                    break
+                result.attempts += 1
+                try:
+                    call = worker(result.input)
+                    if timeout:
+                        call = asyncio.wait_for(call, timeout)
+                    result.output = await call
+                    result.error = None
+                    break
+                except asyncio.TimeoutError:
+                    result.error = f"Timed out after {timeout:g}s"
+                except Exception as e:
+                    result.error = _describe(e)
+                    if not _is_retryable(e):
+                        break
+            if attempt < retries:
+                await asyncio.sleep(retry_backoff * 2**attempt)
+        result.duration = time.monotonic() - start
+        finish(result)
+
+    async def run_group(group: List[BatchItemResult]):
+        start = time.monotonic()
+        outputs = None
+        async with semaphore:
+            if not cancelled():
+                try:
+                    call = batch_worker([r.input for r in group])
+                    if timeout:
+                        call = asyncio.wait_for(call, timeout)
+                    outputs = await call
+                except Exception as e:
+                    logger.warning(
+                        f"Provider batch of {len(group)} failed, "
+                        f"falling back to single requests: {_describe(e)}"
+                    )
+        if outputs is None or len(outputs) != len(group):
+            await asyncio.gather(*[run_item(result) for result in group])
+            return
+        duration = time.monotonic() - start
+        for result, output in zip(group, outputs):
+            result.output = output
+            result.attempts = 1
+            result.duration = duration
+            finish(result)
+
+    if batch_worker is not None and len(results) > 1:
+        size = max(1, provider_batch_size)
+        groups = [results[i : i + size] for i in range(0, len(results), size)]
+        await asyncio.gather(*[run_group(group) for group in groups])
+    else:
+        await asyncio.gather(*[run_item(result) for result in results])
+    return results
+
+
+@dataclass
+class BatchJob:
+    id: str
+    user_id: str
+    total: int
+    status: str = "queued"
+    completed: int = 0
+    failed: int = 0
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    results: List[dict] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+class BatchJobManager:
+    """
+    Background batch jobs with state in SharedCache.
+
+    The task runs in the worker that accepted the job; status, progress and
+    results are written to the shared cache, and cancellation is a shared flag
+    the running job checks before each attempt.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or shared_cache
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"batch_job:{job_id}"
+
+    @staticmethod
+    def _cancel_key(job_id: str) -> str:
+        return f"batch_job:{job_id}:cancel"
+
+    def _save(self, job: BatchJob):
+        self.cache.set(self._key(job.id), asdict(job), ttl=BATCH_JOB_TTL)
+
+    def submit(
+        self,
+        user_id: str,
+        inputs: List[Any],
+        worker: Callable[[Any], Awaitable[str]],
+        metadata: Optional[Dict[str, Any]] = None,
+        **options,
+    ) -> dict:
+        """
+        Start a batch in the background and return its job record.
+
+        `options` are passed to run_batch (concurrency, timeout, retries,
+        batch_worker, provider_batch_size).
+        """
+        if not inputs:
+            raise ValueError("A batch needs at least one input")
+        if len(inputs) > MAX_BATCH_ITEMS:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_ITEMS} inputs")
+        job = BatchJob(
+            id=str(uuid.uuid4()),
+            user_id=str(user_id),
+            total=len(inputs),
+            metadata=metadata or {},
+        )
+        self._save(job)
+        task = asyncio.create_task(self._run(job, inputs, worker, options))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return self._public(asdict(job), include_results=False)
+
+    async def _run(self, job: BatchJob, inputs, worker, options):
+        job.status = "running"
+        job.started_at = datetime.now().isoformat()
+        self._save(job)
+        last_write = time.monotonic()
+
+        def on_result(result: BatchItemResult):
+            nonlocal last_write
+            job.completed += 1
+            if not result.ok:
+                job.failed += 1
+            if time.monotonic() - last_write >= PROGRESS_WRITE_INTERVAL:
+                last_write = time.monotonic()
+                self._save(job)
+
+        try:
+            results = await run_batch(
+                inputs,
+                worker,
+                on_result=on_result,
+                should_cancel=lambda: self.cache.exists(self._cancel_key(job.id)),
+                **options,
+            )
+            job.results = [result.to_dict() for result in results]
+            if self.cache.exists(self._cancel_key(job.id)):
+                job.status = "cancelled"
+            else:
+                job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Batch job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now().isoformat()
+            self._save(job)
+            self.cache.delete(self._cancel_key(job.id))
+
+    @staticmethod
+    def _public(record: dict, include_results: bool = True) -> dict:
+        record = dict(record)
+        if not include_results:
+            record.pop("results", None)
+        return record
+
+    def get(
+        self, job_id: str, user_id: str, include_results: bool = True
+    ) -> Optional[dict]:
+        """Fetch a job record owned by the user, or None"""
+        record = self.cache.get(self._key(job_id))
+        if not record or record.get("user_id") != str(user_id):
+            return None
+        return self._public(record, include_results=include_results)
+
+    def cancel(self, job_id: str, user_id: str) -> bool:
+        """Ask a queued or running job to stop; finished items keep their results"""
+        record = self.get(job_id, user_id, include_results=False)
+        if record is None or record["status"] not in ("queued", "running"):
+            return False
+        self.cache.set(self._cancel_key(job_id), True, ttl=BATCH_JOB_TTL)
+        return True
+
+    async def wait(self, job_id: str) -> None:
+        """Wait for a job started by this worker to finish"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+
+batch_jobs = BatchJobManager()
@@ -0,0 +1,836 @@
+"""
+BillingAnalytics - Precomputed token usage rollups and streamed exports
+
+The admin usage dashboards aggregated the CompanyTokenUsage audit table and
+every user's preferences on each call, so they slowed down as usage history
+grew. Usage is now also kept in `usage_rollup`, one row per
+
+    (granularity, scope, subject, company, bucket)
+
+- granularity: "hour", "day" or "all" (all time, a single bucket)
+- scope: "company", "user" or "agent"; the subject is that company, user or
+  agent, and `company_id` is the company the usage was billed to
+
+`increase_token_counts` adds to the rollups in the same transaction that
+writes the audit row, and marks the row `rolled_up`. Audit rows written
+before rollups existed, or by a worker running older code, are picked up by
+the backfill job. It aggregates a batch of the oldest pending rows in SQL,
+adds them to the rollups and marks them in one transaction, so it can be
+stopped and resumed at any point and never counts a row twice.
+
+Usage recorded while billing was off never had audit rows, only the
+per-user totals in UserPreferences. After the first full backfill, the
+difference between those totals and the rollups is added once to the
+all-time rows (the "baseline" row records what was seeded), so lifetime
+totals still match.
+
+Ranges are answered at hour resolution: the hour containing `start` through
+the hour containing `end`, from day rows for whole days and hour rows for the
+rest.
+"""
+
+import asyncio
+import base64
+import csv
+import io
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import DateTime, String, and_, cast, func, literal, or_, true
+from sqlalchemy.exc import DBAPIError
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+GRANULARITY_HOUR = "hour"
+GRANULARITY_DAY = "day"
+GRANULARITY_ALL = "all"
+GRANULARITIES = (GRANULARITY_HOUR, GRANULARITY_DAY, GRANULARITY_ALL)
+
+SCOPE_COMPANY = "company"
+SCOPE_USER = "user"
+SCOPE_AGENT = "agent"
+SCOPES = (SCOPE_COMPANY, SCOPE_USER, SCOPE_AGENT)
+# Bookkeeping row recording the seeded preference totals
+SCOPE_BASELINE = "baseline"
+
+# Bucket of the all-time rows
+ALL_TIME = datetime(1970, 1, 1)
+
+KEY_COLUMNS = ("granularity", "scope", "subject_id", "company_id", "bucket_start")
+VALUE_COLUMNS = ("input_tokens", "output_tokens", "total_tokens", "usage_count")
+
+# Audit rows claimed per backfill transaction
+BACKFILL_BATCH_SIZE = int(os.getenv("USAGE_ROLLUP_BACKFILL_BATCH", "5000"))
+# How often a worker looks for audit rows still to roll up
+BACKFILL_INTERVAL = (
+    float(os.getenv("USAGE_ROLLUP_BACKFILL_INTERVAL_MINUTES", "60")) * 60
+)
+# Rows fetched per query while streaming an export
+EXPORT_BATCH_SIZE = 1000
+
+
+@dataclass
+class UsageModels:
+    """The tables the rollups are built from; DB models in production"""
+
+    usage: Any
+    rollup: Any
+    preferences: Any = None
+    user_company: Any = None
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == GRANULARITY_HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == GRANULARITY_DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ALL_TIME
+
+
+def add_usage(
+    deltas: Dict[tuple, List[int]],
+    company_id,
+    user_id,
+    agent_id,
+    input_tokens: int,
+    output_tokens: int,
+    timestamp: datetime,
+    total_tokens: Optional[int] = None,
+    count: int = 1,
+):
+    """Add one usage record to `deltas`, keyed like the rollup rows"""
+    company = str(company_id) if company_id else ""
+    subjects = [(SCOPE_USER, str(user_id))]
+    if company:
+        subjects.append((SCOPE_COMPANY, company))
+    if agent_id:
+        subjects.append((SCOPE_AGENT, str(agent_id)))
+    if total_tokens is None:
+        total_tokens = input_tokens + output_tokens
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(timestamp, granularity)
+        for scope, subject_id in subjects:
+            values = deltas.setdefault(
+                (granularity, scope, subject_id, company, bucket), [0, 0, 0, 0]
+            )
+            values[0] += input_tokens or 0
+            values[1] += output_tokens or 0
+            values[2] += total_tokens or 0
+            values[3] += count
+
+
+def _insert(session, table):
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def apply_deltas(session, rollup_model, deltas: Dict[tuple, List[int]]) -> int:
+    """Upsert `deltas` into the rollup table; does not commit"""
+    if not deltas:
+        return 0
+    table = rollup_model.__table__
+    statement = _insert(session, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(KEY_COLUMNS),
+        set_={
+            column: table.c[column] + statement.excluded[column]
+            for column in VALUE_COLUMNS
+        },
+    )
+    # A fixed order so concurrent writers lock rows in the same order
+    session.execute(
+        statement,
+        [
+            {**dict(zip(KEY_COLUMNS, key)), **dict(zip(VALUE_COLUMNS, deltas[key]))}
+            for key in sorted(deltas)
+        ],
+    )
+    return len(deltas)
+
+
+def record_usage(
+    session,
+    rollup_model,
+    company_id,
+    user_id,
+    agent_id,
+    input_tokens: int,
+    output_tokens: int,
+    timestamp: datetime,
+) -> bool:
+    """
+    Add one request's usage to the rollups inside the caller's transaction.
+    Returns False, leaving the transaction usable, if the rollups could not
+    be written; the audit row is then left for the backfill.
+    """
+    deltas = {}
+    add_usage(
+        deltas, company_id, user_id, agent_id, input_tokens, output_tokens, timestamp
+    )
+    try:
+        with session.begin_nested():
+            apply_deltas(session, rollup_model, deltas)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not update usage rollups: {e}")
+        return False
+
+
+def pending_filter(usage_model):
+    return usage_model.rolled_up.is_not(true())
+
+
+def _bucket_expression(dialect: str, timestamp, granularity: str):
+    """`bucket_start` computed in SQL, equal to what the write path stores"""
+    if granularity == GRANULARITY_ALL:
+        return literal(ALL_TIME, DateTime())
+    if dialect == "postgresql":
+        return func.date_trunc(granularity, timestamp)
+    # SQLAlchemy stores SQLite datetimes as text in this format
+    if granularity == GRANULARITY_HOUR:
+        return func.strftime("%Y-%m-%d %H:00:00.000000", timestamp)
+    return func.strftime("%Y-%m-%d 00:00:00.000000", timestamp)
+
+
+def _new_id_expression(dialect: str):
+    if dialect == "postgresql":
+        return func.gen_random_uuid()
+    return func.lower(func.hex(func.randomblob(16)))
+
+
+def _is_serialization_failure(error: DBAPIError) -> bool:
+    return getattr(error.orig, "pgcode", None) == "40001"
+
+
+def backfill_batch(
+    session, models: UsageModels, batch_size: int = BACKFILL_BATCH_SIZE
+) -> int:
+    """
+    Roll up the oldest `batch_size` audit rows not yet rolled up and mark
+    them, in one transaction. Returns the rows processed, 0 when none are
+    left.
+
+    The rows are aggregated in the database, one INSERT ... SELECT ... ON
+    CONFLICT per granularity and scope. All statements of a batch read one
+    snapshot (REPEATABLE READ on PostgreSQL, SQLite allows one writer), so
+    a batch that another run claimed first fails to mark its rows and is
+    rolled back instead of being counted twice.
+    """
+    usage, rollup = models.usage, models.rollup
+    dialect = session.get_bind().dialect.name
+    for attempt in range(3):
+        if session.in_transaction():
+            session.commit()
+        if dialect == "postgresql":
+            session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        try:
+            window = pending_filter(usage)
+            boundary = (
+                session.query(usage.timestamp, usage.id)
+                .filter(window)
+                .order_by(usage.timestamp, usage.id)
+                .offset(batch_size - 1)
+                .limit(1)
+                .first()
+            )
+            if boundary is not None:
+                window = and_(
+                    window,
+                    or_(
+                        usage.timestamp < boundary.timestamp,
+                        and_(
+                            usage.timestamp == boundary.timestamp,
+                            usage.id <= boundary.id,
+                        ),
+                    ),
+                )
+            subjects = {
+                SCOPE_USER: (usage.user_id, None),
+                SCOPE_COMPANY: (usage.company_id, usage.company_id.isnot(None)),
+                SCOPE_AGENT: (
+                    usage.agent_id,
+                    and_(usage.agent_id.isnot(None), usage.agent_id != ""),
+                ),
+            }
+            table = rollup.__table__
+            for granularity in GRANULARITIES:
+                bucket = _bucket_expression(dialect, usage.timestamp, granularity)
+                for scope, (subject, condition) in subjects.items():
+                    subject_id = cast(subject, String)
+                    company_id = func.coalesce(cast(usage.company_id, String), "")
+                    groups = [subject_id, company_id]
+                    if granularity != GRANULARITY_ALL:
+                        groups.append(bucket)
+                    select = (
+                        session.query(
+                            _new_id_expression(dialect),
+                            literal(granularity),
+                            literal(scope),
+                            subject_id,
+                            company_id,
+                            bucket,
+                            func.sum(usage.input_tokens),
+                            func.sum(usage.output_tokens),
+                            func.sum(usage.total_tokens),
+                            func.count(),
+                        )
+                        .filter(
+                            window if condition is None else and_(window, condition)
+                        )
+                        .group_by(*groups)
+                        .subquery()
+                        .select()
+                        # SQLite needs a WHERE to parse SELECT ... ON CONFLICT
+                        .where(true())
+                    )
+                    statement = _insert(session, table).from_select(
+                        ["id", *KEY_COLUMNS, *VALUE_COLUMNS], select
+                    )
+                    statement = statement.on_conflict_do_update(
+                        index_elements=list(KEY_COLUMNS),
+                        set_={
+                            column: table.c[column] + statement.excluded[column]
+                            for column in VALUE_COLUMNS
+                        },
+                    )
+                    session.execute(statement)
+            processed = (
+                session.query(usage)
+                .filter(window)
+                .update({usage.rolled_up: True}, synchronize_session=False)
+            )
+            session.commit()
+            return processed
+        except DBAPIError as e:
+            session.rollback()
+            if not _is_serialization_failure(e):
+                raise
+            logger.info("Usage rollup batch was claimed by another worker, retrying")
+    return 0
+
+
+def pending_rows(session, usage_model) -> int:
+    return (
+        session.query(func.count(usage_model.id))
+        .filter(pending_filter(usage_model))
+        .scalar()
+    )
+
+
+def _int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def baseline_seeded(session, rollup_model) -> bool:
+    return (
+        session.query(rollup_model.id)
+        .filter(rollup_model.scope == SCOPE_BASELINE)
+        .first()
+        is not None
+    )
+
+
+def seed_preference_baseline(session, models: UsageModels) -> dict:
+    """
+    Add the usage in UserPreferences that the rollups do not account for to
+    the all-time user and company rows, once. Run after the backfill has
+    caught up; rows still pending are subtracted so they are not counted
+    twice when they are rolled up later.
+    """
+    if baseline_seeded(session, models.rollup):
+        return {"users": 0, "input_tokens": 0, "output_tokens": 0}
+    preferences, rollup, usage = models.preferences, models.rollup, models.usage
+    # Locked so in-flight requests finish before the totals are compared
+    totals = {}
+    for user_id, key, value in (
+        session.query(preferences.user_id, preferences.pref_key, preferences.pref_value)
+        .filter(preferences.pref_key.in_(["input_tokens", "output_tokens"]))
+        .with_for_update()
+    ):
+        totals.setdefault(str(user_id), [0, 0])[
+            0 if key == "input_tokens" else 1
+        ] += _int(value)
+    for user_id, input_tokens, output_tokens in (
+        session.query(
+            rollup.subject_id,
+            func.sum(rollup.input_tokens),
+            func.sum(rollup.output_tokens),
+        )
+        .filter(rollup.granularity == GRANULARITY_ALL, rollup.scope == SCOPE_USER)
+        .group_by(rollup.subject_id)
+    ):
+        if user_id in totals:
+            totals[user_id][0] -= _int(input_tokens)
+            totals[user_id][1] -= _int(output_tokens)
+    for user_id, input_tokens, output_tokens in (
+        session.query(
+            usage.user_id, func.sum(usage.input_tokens), func.sum(usage.output_tokens)
+        )
+        .filter(pending_filter(usage))
+        .group_by(usage.user_id)
+    ):
+        if str(user_id) in totals:
+            totals[str(user_id)][0] -= _int(input_tokens)
+            totals[str(user_id)][1] -= _int(output_tokens)
+    companies = {}
+    if models.user_company is not None:
+        memberships = models.user_company
+        for user_id, company_id in session.query(
+            memberships.user_id, memberships.company_id
+        ):
+            # Like increase_token_counts, the user's first company
+            companies.setdefault(str(user_id), str(company_id))
+
+    deltas = {}
+    seeded = [0, 0, 0]
+    for user_id, (input_tokens, output_tokens) in totals.items():
+        input_tokens, output_tokens = max(0, input_tokens), max(0, output_tokens)
+        if not input_tokens and not output_tokens:
+            continue
+        company = companies.get(user_id, "")
+        subjects = [(SCOPE_USER, user_id)]
+        if company:
+            subjects.append((SCOPE_COMPANY, company))
+        for scope, subject_id in subjects:
+            values = deltas.setdefault(
+                (GRANULARITY_ALL, scope, subject_id, company, ALL_TIME), [0, 0, 0, 0]
+            )
+            values[0] += input_tokens
+            values[1] += output_tokens
+            values[2] += input_tokens + output_tokens
+        seeded[0] += 1
+        seeded[1] += input_tokens
+        seeded[2] += output_tokens
+    deltas[(GRANULARITY_ALL, SCOPE_BASELINE, "preferences", "", ALL_TIME)] = [
+        seeded[1],
+        seeded[2],
+        seeded[1] + seeded[2],
+        seeded[0],
+    ]
+    apply_deltas(session, rollup, deltas)
+    session.commit()
+    return {"users": seeded[0], "input_tokens": seeded[1], "output_tokens": seeded[2]}
+
+
+def parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    """ISO date from a query parameter, as naive time like the audit rows"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid {name} format")
+    return parsed.replace(tzinfo=None)
+
+
+def _ceil_day(value: datetime) -> datetime:
+    day = bucket_start(value, GRANULARITY_DAY)
+    return day if day == value else day + timedelta(days=1)
+
+
+def range_filter(rollup_model, start: Optional[datetime], end: Optional[datetime]):
+    """
+    Rollup rows covering [start, end] at hour resolution without overlap:
+    all-time rows when unbounded, otherwise day rows for the whole days and
+    hour rows for the partial days at either end.
+    """
+    rollup = rollup_model
+    if start is None and end is None:
+        return rollup.granularity == GRANULARITY_ALL
+    first_hour = bucket_start(start, GRANULARITY_HOUR) if start else None
+    end_hour = bucket_start(end, GRANULARITY_HOUR) + timedelta(hours=1) if end else None
+    first_day = _ceil_day(first_hour) if first_hour else None
+    end_day = bucket_start(end_hour, GRANULARITY_DAY) if end_hour else None
+
+    def between(granularity, low, high):
+        conditions = [rollup.granularity == granularity]
+        if low is not None:
+            conditions.append(rollup.bucket_start >= low)
+        if high is not None:
+            conditions.append(rollup.bucket_start < high)
+        return and_(*conditions)
+
+    if first_day is not None and end_day is not None and first_day >= end_day:
+        return between(GRANULARITY_HOUR, first_hour, end_hour)
+    parts = [between(GRANULARITY_DAY, first_day, end_day)]
+    if first_hour is not None and first_hour < first_day:
+        parts.append(between(GRANULARITY_HOUR, first_hour, first_day))
+    if end_hour is not None and end_day < end_hour:
+        parts.append(between(GRANULARITY_HOUR, end_day, end_hour))
+    return or_(*parts)
+
+
+def usage_totals(
+    session,
+    rollup_model,
+    scope: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    subject_ids: Optional[Sequence] = None,
+    company_id=None,
+) -> Dict[str, dict]:
+    """Tokens and request counts per subject of `scope` in a range"""
+    rollup = rollup_model
+    query = session.query(
+        rollup.subject_id,
+        func.sum(rollup.input_tokens),
+        func.sum(rollup.output_tokens),
+        func.sum(rollup.total_tokens),
+        func.sum(rollup.usage_count),
+    ).filter(rollup.scope == scope, range_filter(rollup, start, end))
+    if subject_ids is not None:
+        if not subject_ids:
+            return {}
+        query = query.filter(rollup.subject_id.in_([str(s) for s in subject_ids]))
+    if company_id is not None:
+        query = query.filter(rollup.company_id == str(company_id))
+    return {
+        subject_id: {
+            "input_tokens": _int(input_tokens),
+            "output_tokens": _int(output_tokens),
+            "total_tokens": _int(total_tokens),
+            "usage_count": _int(usage_count),
+        }
+        for subject_id, input_tokens, output_tokens, total_tokens, usage_count in (
+            query.group_by(rollup.subject_id)
+        )
+    }
+
+
+def raw_usage_totals(
+    session,
+    usage_model,
+    scope: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Dict[str, dict]:
+    """The same totals aggregated from the audit table, for verification"""
+    usage = usage_model
+    subject = {
+        SCOPE_COMPANY: usage.company_id,
+        SCOPE_USER: usage.user_id,
+        SCOPE_AGENT: usage.agent_id,
+    }[scope]
+    query = session.query(
+        subject,
+        func.sum(usage.input_tokens),
+        func.sum(usage.output_tokens),
+        func.sum(usage.total_tokens),
+        func.count(usage.id),
+    ).filter(subject.isnot(None))
+    if start is not None:
+        query = query.filter(usage.timestamp >= bucket_start(start, GRANULARITY_HOUR))
+    if end is not None:
+        query = query.filter(
+            usage.timestamp < bucket_start(end, GRANULARITY_HOUR) + timedelta(hours=1)
+        )
+    return {
+        str(subject_id): {
+            "input_tokens": _int(input_tokens),
+            "output_tokens": _int(output_tokens),
+            "total_tokens": _int(total_tokens),
+            "usage_count": _int(usage_count),
+        }
+        for subject_id, input_tokens, output_tokens, total_tokens, usage_count in (
+            query.group_by(subject)
+        )
+    }
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps(list(values), default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[list]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _cursor_value(column, value):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def keyset_page(
+    query,
+    columns: Sequence,
+    cursor: Optional[str],
+    limit: int,
+    descending: bool,
+    key: Callable[[Any], Sequence],
+):
+    """
+    Order `query` by `columns` and return the page after `cursor` plus the
+    cursor of the next page (None on the last page). `key` gives a row's
+    values of `columns`; together they must be unique so the order is total.
+    """
+    after = decode_cursor(cursor)
+    if after is not None:
+        if len(after) != len(columns):
+            raise ValueError("Invalid cursor")
+        after = [_cursor_value(c, v) for c, v in zip(columns, after)]
+        # (a, b) < (x, y) spelled out, which every backend can use
+        condition = None
+        for index in reversed(range(len(columns))):
+            column, value = columns[index], after[index]
+            step = column < value if descending else column > value
+            condition = (
+                step
+                if condition is None
+                else or_(step, and_(column == value, condition))
+            )
+        query = query.filter(condition)
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key(rows[-1]))
+    return rows, next_cursor
+
+
+def rollup_rows(
+    session,
+    rollup_model,
+    granularity: str,
+    scope: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    company_id=None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[dict]:
+    """Stream rollup rows in (bucket, subject, company) order, a batch per query"""
+    rollup = rollup_model
+    query = session.query(rollup).filter(
+        rollup.granularity == granularity, rollup.scope == scope
+    )
+    if start is not None:
+        query = query.filter(rollup.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        query = query.filter(rollup.bucket_start <= end)
+    if company_id is not None:
+        query = query.filter(rollup.company_id == str(company_id))
+    columns = [rollup.bucket_start, rollup.subject_id, rollup.company_id]
+    cursor = None
+    while True:
+        page, cursor = keyset_page(
+            query,
+            columns,
+            cursor,
+            batch_size,
+            False,
+            key=lambda row: (row.bucket_start, row.subject_id, row.company_id),
+        )
+        for row in page:
+            yield rollup_to_dict(row)
+        if cursor is None:
+            return
+
+
+def rollup_to_dict(row) -> dict:
+    return {
+        "bucket_start": (
+            row.bucket_start.isoformat() if row.granularity != GRANULARITY_ALL else None
+        ),
+        "granularity": row.granularity,
+        "scope": row.scope,
+        "subject_id": row.subject_id,
+        "company_id": row.company_id or None,
+        "input_tokens": _int(row.input_tokens),
+        "output_tokens": _int(row.output_tokens),
+        "total_tokens": _int(row.total_tokens),
+        "usage_count": _int(row.usage_count),
+    }
+
+
+def iter_csv(
+    columns: Sequence[str], rows: Iterable[dict], flush_every: int = 500
+) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(columns), extrasaction="ignore")
+    writer.writeheader()
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % flush_every == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+def iter_json_document(columns: Sequence[str], rows: Iterable[dict]) -> Iterator[str]:
+    """{"columns": [...], "rows": [...], "total_rows": n}, written as it goes"""
+    yield '{"columns": ' + json.dumps(list(columns)) + ', "rows": ['
+    count = 0
+    for row in rows:
+        yield ("," if count else "") + json.dumps(row, default=str)
+        count += 1
+    yield '], "total_rows": ' + str(count) + "}"
+
+
+class UsageRollupService:
+    """
+    Runs the backfill in the background: at startup and then every
+    BACKFILL_INTERVAL, one worker at a time, until no audit rows are left.
+    """
+
+    def __init__(
+        self,
+        interval: float = BACKFILL_INTERVAL,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        cache=None,
+        session_factory: Optional[Callable] = None,
+        models: Optional[UsageModels] = None,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.cache = cache or shared_cache
+        self._session_factory = session_factory
+        self._models = models
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "backfill_runs": 0,
+            "rows_backfilled": 0,
+            "backfill_seconds": 0.0,
+            "baseline_users": 0,
+            "last_backfill": None,
+        }
+
+    def _session(self):
+        if self._session_factory is not None:
+            return self._session_factory()
+        from DB import get_session
+
+        return get_session()
+
+    def models(self) -> UsageModels:
+        if self._models is None:
+            from DB import CompanyTokenUsage, UsageRollup, UserCompany, UserPreferences
+
+            self._models = UsageModels(
+                usage=CompanyTokenUsage,
+                rollup=UsageRollup,
+                preferences=UserPreferences,
+                user_company=UserCompany,
+            )
+        return self._models
+
+    def backfill(self, max_batches: Optional[int] = None) -> int:
+        """
+        Roll up pending audit rows; resumes wherever the last run stopped.
+        Seeds the preference baseline once nothing is pending.
+        """
+        models = self.models()
+        started = time.perf_counter()
+        processed = 0
+        batches = 0
+        session = self._session()
+        try:
+            while max_batches is None or batches < max_batches:
+                done = backfill_batch(session, models, self.batch_size)
+                if not done:
+                    break
+                processed += done
+                batches += 1
+                self.stats["rows_backfilled"] += done
+            if models.preferences is not None and not pending_rows(
+                session, models.usage
+            ):
+                seeded = seed_preference_baseline(session, models)
+                self.stats["baseline_users"] += seeded["users"]
+                if seeded["users"]:
+                    logger.info(
+                        f"Seeded usage rollups with the preference totals of "
+                        f"{seeded['users']} users"
+                    )
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+            self.stats["backfill_runs"] += 1
+            self.stats["backfill_seconds"] += time.perf_counter() - started
+            self.stats["last_backfill"] = datetime.now().isoformat()
+        if processed:
+            logger.info(
+                f"Rolled up {processed} token usage records in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+        return processed
+
+    async def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self.running = False
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _loop(self):
+        while self.running:
+            try:
+                if self.cache.set_if_not_exists(
+                    "usage_rollup:lock", os.getpid(), ttl=int(self.interval)
+                ):
+                    await asyncio.to_thread(self.backfill)
+            except Exception as e:
+                logger.error(f"Usage rollup backfill failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self, session=None) -> dict:
+        stats = dict(self.stats)
+        stats["backfill_seconds"] = round(stats["backfill_seconds"], 2)
+        stats["running"] = self.running
+        if session is not None:
+            models = self.models()
+            stats["pending_rows"] = pending_rows(session, models.usage)
+            stats["baseline_seeded"] = baseline_seeded(session, models.rollup)
+        return stats
+
+
+usage_rollups = UsageRollupService()
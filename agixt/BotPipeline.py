@@ -0,0 +1,430 @@
+"""
+BotPipeline - Shared inbound and outbound message handling for chat bots
+
+Each bot manager used to handle a platform event start to finish inside the
+event callback: map the sender to a user, fetch channel context, call the
+agent, wait for the whole reply and post it. Lookups repeated per message,
+every message of a rapid burst ("hi" / "one more thing" / "...") became its
+own agent turn, and users saw nothing until the full reply was generated.
+
+The pipeline splits that into shared pieces:
+
+- `InboundMessage`: a platform event normalized to the fields bots use
+- `ConversationPipeline`: a per-conversation ordering queue; messages that
+  arrive within `BOT_DEBOUNCE_SECONDS` of each other are merged into one
+  agent turn, and a conversation never has two turns in flight
+- `LookupCache`: TTL caches for platform user and channel lookups, shared
+  by every bot in the process, including short-lived negative entries
+- `StreamingReply`: posts the reply as soon as the first tokens arrive,
+  edits it as more stream in and continues in a new message when the
+  platform's length limit is reached
+
+Usage:
+    pipeline = ConversationPipeline(self._handle_inbound, inbox=self.inbox)
+    pipeline.submit(InboundMessage(platform="slack", ...))
+
+    reply = StreamingReply(send=post, edit=update, max_length=4000)
+    async for delta in iter_stream_content(agixt.chat_completions_stream(p)):
+        await reply.push(delta)
+    await reply.finish()
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Quiet period that ends a burst of messages, and the longest a burst is held
+BOT_DEBOUNCE_SECONDS = float(os.getenv("BOT_DEBOUNCE_SECONDS", "1.0"))
+BOT_DEBOUNCE_MAX_WAIT = float(os.getenv("BOT_DEBOUNCE_MAX_WAIT", "4.0"))
+# Most messages merged into one agent turn
+BOT_MAX_BATCH = int(os.getenv("BOT_MAX_BATCH", "10"))
+# Minimum seconds between edits of a streaming reply (platform rate limits)
+BOT_STREAM_EDIT_INTERVAL = float(os.getenv("BOT_STREAM_EDIT_INTERVAL", "1.0"))
+# Characters collected before the first reply is posted
+BOT_STREAM_FIRST_CHARS = int(os.getenv("BOT_STREAM_FIRST_CHARS", "24"))
+# Platform user / channel lookups; misses are kept shorter
+BOT_LOOKUP_TTL = int(os.getenv("BOT_LOOKUP_TTL", "300"))
+BOT_LOOKUP_MISS_TTL = int(os.getenv("BOT_LOOKUP_MISS_TTL", "30"))
+BOT_LOOKUP_MAX_ENTRIES = int(os.getenv("BOT_LOOKUP_MAX_ENTRIES", "10000"))
+
+
+@dataclass
+class InboundMessage:
+    """A platform message normalized for the pipeline."""
+
+    platform: str
+    company_id: str
+    conversation_key: str
+    user_id: str
+    text: str
+    channel_id: str = ""
+    message_id: str = ""
+    # Where the reply goes: a Slack thread, the Telegram message replied to
+    reply_to: str = ""
+    files: List[dict] = field(default_factory=list)
+    is_command: bool = False
+    raw: Dict[str, Any] = field(default_factory=dict)
+    received_at: float = field(default_factory=time.monotonic)
+    batch_size: int = 1
+
+    @classmethod
+    def combine(cls, messages: List["InboundMessage"]) -> "InboundMessage":
+        """Merge a burst into one message that replies to the latest one."""
+        if len(messages) == 1:
+            return messages[0]
+        last = messages[-1]
+        return replace(
+            last,
+            text="\n".join(m.text for m in messages if m.text),
+            files=[f for m in messages for f in m.files],
+            received_at=messages[0].received_at,
+            batch_size=sum(m.batch_size for m in messages),
+        )
+
+
+class LookupCache:
+    """
+    Thread-safe TTL + LRU cache for platform lookups.
+
+    A loader returning None is cached for the shorter miss TTL, so an unknown
+    user does not trigger a lookup on every message.
+    """
+
+    def __init__(
+        self,
+        ttl: int = BOT_LOOKUP_TTL,
+        miss_ttl: int = BOT_LOOKUP_MISS_TTL,
+        max_entries: int = BOT_LOOKUP_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_or_load(self, key: Any, loader: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            self.stats["misses"] += 1
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key: Any, value: Any):
+        ttl = self.ttl if value is not None else self.miss_ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Any = None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "entries": len(self._entries)}
+
+
+# Shared by every bot in the process
+platform_users = LookupCache()
+platform_channels = LookupCache()
+
+
+class ConversationPipeline:
+    """
+    Orders and batches inbound messages per conversation.
+
+    Each conversation has at most one worker. It waits until no message has
+    arrived for `debounce` seconds (but at most `max_wait` from the first),
+    merges what arrived into one turn and runs the handler, then takes the
+    messages that came in meanwhile. Commands are never merged. With an
+    inbox, turns run through it and count against the company's limits.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[InboundMessage], Awaitable],
+        inbox=None,
+        debounce: float = BOT_DEBOUNCE_SECONDS,
+        max_wait: float = BOT_DEBOUNCE_MAX_WAIT,
+        max_batch: int = BOT_MAX_BATCH,
+    ):
+        self.handler = handler
+        self.inbox = inbox
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.max_batch = max(1, max_batch)
+        self._pending: Dict[str, List[InboundMessage]] = {}
+        self._arrived: Dict[str, asyncio.Event] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        # Platforms may deliver one message as several events
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self.stats = {
+            "received": 0,
+            "duplicates": 0,
+            "turns": 0,
+            "merged": 0,
+            "dropped": 0,
+        }
+
+    def submit(self, message: InboundMessage):
+        """Queue a message; call from the event loop."""
+        key = message.conversation_key
+        if message.message_id:
+            seen = (key, message.message_id)
+            if seen in self._seen:
+                self.stats["duplicates"] += 1
+                return
+            self._seen[seen] = None
+            if len(self._seen) > 1000:
+                self._seen.popitem(last=False)
+        self.stats["received"] += 1
+        self._pending.setdefault(key, []).append(message)
+        self._arrived.setdefault(key, asyncio.Event()).set()
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+
+    async def _drain(self, key: str):
+        try:
+            while self._pending.get(key):
+                batch = await self._collect(key)
+                await self._run(InboundMessage.combine(batch))
+        finally:
+            self._workers.pop(key, None)
+            if not self._pending.get(key):
+                self._pending.pop(key, None)
+                self._arrived.pop(key, None)
+
+    def _mergeable(self, pending: List[InboundMessage]) -> int:
+        count = 0
+        for message in pending[: self.max_batch]:
+            if message.is_command:
+                break
+            count += 1
+        return count
+
+    async def _collect(self, key: str) -> List[InboundMessage]:
+        pending = self._pending[key]
+        if pending[0].is_command:
+            return [pending.pop(0)]
+        arrived = self._arrived[key]
+        deadline = pending[0].received_at + self.max_wait
+        while True:
+            count = self._mergeable(pending)
+            if count >= self.max_batch or count < len(pending):
+                break
+            now = time.monotonic()
+            quiet_until = min(pending[-1].received_at + self.debounce, deadline)
+            if quiet_until <= now:
+                break
+            arrived.clear()
+            try:
+                await asyncio.wait_for(arrived.wait(), quiet_until - now)
+            except asyncio.TimeoutError:
+                break
+        count = self._mergeable(pending)
+        batch = pending[:count]
+        del pending[:count]
+        return batch
+
+    async def _run(self, message: InboundMessage):
+        self.stats["turns"] += 1
+        self.stats["merged"] += message.batch_size - 1
+        if self.inbox is None:
+            await self._call(message)
+            return
+        # Run inside the company inbox, but keep this conversation's order
+        done = asyncio.get_running_loop().create_future()
+
+        async def turn():
+            try:
+                await self._call(message)
+            finally:
+                if not done.done():
+                    done.set_result(None)
+
+        if not self.inbox.submit(turn):
+            self.stats["dropped"] += message.batch_size
+            return
+        await done
+
+    async def _call(self, message: InboundMessage):
+        try:
+            await self.handler(message)
+        except Exception as e:
+            logger.error(
+                f"{message.platform} message handler failed for conversation "
+                f"{message.conversation_key}: {e}"
+            )
+
+    async def close(self):
+        for task in list(self._workers.values()):
+            task.cancel()
+        for task in list(self._workers.values()):
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._workers.clear()
+        self._pending.clear()
+        self._arrived.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "conversations": len(self._workers),
+            "queued": sum(len(p) for p in self._pending.values()),
+        }
+
+
+def split_message(text: str, max_length: int = 4000) -> List[str]:
+    """Split text into chunks of at most max_length, preferring line and word breaks."""
+    if len(text) <= max_length:
+        return [text]
+
+    chunks = []
+    remaining = text
+
+    while len(remaining) > max_length:
+        split_point = remaining.rfind("\n", 0, max_length)
+        if split_point == -1 or split_point < max_length * 0.3:
+            split_point = remaining.rfind(" ", 0, max_length)
+        if split_point <= 0:
+            split_point = max_length
+
+        chunks.append(remaining[:split_point].rstrip())
+        remaining = remaining[split_point:].lstrip()
+
+    if remaining:
+        chunks.append(remaining)
+
+    return chunks
+
+
+async def iter_stream_content(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Yield the content deltas of a chat_completions_stream SSE stream."""
+    async for chunk in chunks:
+        for line in chunk.split("\n"):
+            line = line.strip()
+            if not line.startswith("data: "):
+                continue
+            data = line[6:].strip()
+            if data == "[DONE]":
+                return
+            try:
+                chunk_data = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            choices = chunk_data.get("choices") or []
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content", "")
+                if content:
+                    yield content
+
+
+class StreamingReply:
+    """
+    Streams an agent reply into platform messages.
+
+    `send(text)` posts a new message and returns a handle for `edit(handle,
+    text)`. Without `edit`, text is posted in full chunks as they fill up.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        edit: Optional[Callable[[Any, str], Awaitable[Any]]] = None,
+        max_length: int = 4000,
+        edit_interval: float = BOT_STREAM_EDIT_INTERVAL,
+        first_chars: int = BOT_STREAM_FIRST_CHARS,
+    ):
+        self.send = send
+        self.edit = edit
+        self.max_length = max_length
+        self.edit_interval = edit_interval
+        self.first_chars = first_chars
+        self.started_at = time.monotonic()
+        self.first_reply_at: Optional[float] = None
+        self.messages: List[str] = []
+        self.edits = 0
+        self._text = ""
+        self._handle = None
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def _post(self, text: str):
+        handle = await self.send(text)
+        if self.first_reply_at is None:
+            self.first_reply_at = time.monotonic()
+        self._last_edit = time.monotonic()
+        return handle
+
+    async def _show(self, text: str):
+        if self._handle is None:
+            self._handle = await self._post(text)
+        elif text != self._shown:
+            await self.edit(self._handle, text)
+            self.edits += 1
+            self._last_edit = time.monotonic()
+        self._shown = text
+
+    async def _complete(self, text: str):
+        """Finish the current message with its final text."""
+        if self._handle is not None:
+            if text != self._shown:
+                await self.edit(self._handle, text)
+                self.edits += 1
+        else:
+            await self._post(text)
+        self.messages.append(text)
+        self._handle = None
+        self._shown = ""
+
+    async def push(self, delta: str):
+        self._text += delta
+        while len(self._text) > self.max_length:
+            head = split_message(self._text, self.max_length)[0]
+            await self._complete(head)
+            self._text = self._text[len(head) :].lstrip()
+        if self.edit is None or not self._text.strip():
+            return
+        if self._handle is None:
+            if len(self._text.strip()) >= self.first_chars:
+                await self._show(self._text)
+        elif time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._show(self._text)
+
+    async def finish(
+        self, fallback: str = "I couldn't generate a response."
+    ) -> List[str]:
+        text = self._text.strip()
+        if text:
+            await self._complete(text)
+        elif not self.messages:
+            await self._complete(fallback)
+        self._text = ""
+        return self.messages
+
+    @property
+    def time_to_first_reply(self) -> Optional[float]:
+        if self.first_reply_at is None:
+            return None
+        return self.first_reply_at - self.started_at
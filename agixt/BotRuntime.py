@@ -0,0 +1,529 @@
+"""
+BotRuntime - Sharded ownership of per-company chat bots
+
+The bot managers (Discord, Slack, ...) used to run every company's bot in one
+event loop of the main process and re-read every company's configuration
+every 60 seconds. A slow message handler for one tenant delayed all others,
+and a configuration change took up to a minute to apply.
+
+The runtime spreads bots over N worker processes:
+
+- companies are assigned to workers with a consistent hash ring built from
+  the workers whose heartbeat is alive, so a worker joining or leaving only
+  moves its own share of companies
+- a worker only starts a bot while it holds that bot's lease in SharedCache;
+  leases are renewed with the heartbeat and released on stop, so a bot is
+  never run by two workers while ownership moves
+- configuration changes are published as events (`publish_bot_config_change`)
+  and applied for that one company; a slow full resync remains only as a
+  safety net for lost events
+- every bot gets a `CompanyInbox`: a bounded queue drained by a few
+  handlers, so one tenant's slow handler cannot hold up the others and a
+  flooded tenant is refused instead of growing an unbounded backlog
+
+Managers plug in by providing:
+
+- `bots`: dict of running bots by id, and `SERVER_BOT_ID`
+- `get_company_bot_config(company_id=None)`: configs by company id
+- `is_bot_runnable(config)`: whether a config has what a bot needs
+- `get_server_bot_config()`: the shared server-level bot config, or None
+- `start_bot_from_config(bot_id, config)` and `stop_bot_for_company(bot_id)`
+
+Run workers with `python BotRuntime.py` and BOT_WORKERS / BOT_WORKER_INDEX.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Number of bot worker processes and this process's position among them
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+BOT_WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "0"))
+# Seconds a worker keeps a bot (and its heartbeat) without renewing it
+BOT_LEASE_TTL = int(os.getenv("BOT_LEASE_TTL", "30"))
+# Full resync of all company configs, a safety net for lost events
+BOT_RESYNC_INTERVAL = int(os.getenv("BOT_RESYNC_INTERVAL", "600"))
+# Per-company inbound queue: waiting messages and messages handled at once
+BOT_INBOX_SIZE = int(os.getenv("BOT_INBOX_SIZE", "100"))
+BOT_INBOX_CONCURRENCY = int(os.getenv("BOT_INBOX_CONCURRENCY", "2"))
+# Points per worker on the hash ring
+BOT_RING_REPLICAS = 64
+
+BOT_CONFIG_CHANNEL = "bot_config_events"
+
+# Platforms whose managers run on a BotRuntime and apply config events.
+# Telegram, X, GitHub and the email managers still run their own 60 second
+# sync loop: their configs are keyed differently and porting them is a
+# follow-up.
+RUNTIME_PLATFORMS = ("discord", "slack", "teams")
+
+
+def publish_bot_config_change(platform: str, company_id: str, cache=None) -> int:
+    """Tell the bot workers that a company's bot configuration changed."""
+    cache = cache or shared_cache
+    try:
+        return cache.publish(
+            BOT_CONFIG_CHANNEL, {"platform": platform, "company_id": str(company_id)}
+        )
+    except Exception as e:
+        logger.warning(f"Failed to publish {platform} bot config change: {e}")
+        return 0
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes."""
+
+    def __init__(self, nodes: List[Any], replicas: int = BOT_RING_REPLICAS):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (_ring_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> Any:
+        if not self._nodes:
+            return None
+        index = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class CompanyInbox:
+    """
+    Bounded inbound queue for one company's bot.
+
+    `submit` never waits: when the queue is full the message is refused and
+    counted, and the caller decides how to tell the sender.
+    """
+
+    def __init__(
+        self,
+        company_id: str,
+        maxsize: int = BOT_INBOX_SIZE,
+        concurrency: int = BOT_INBOX_CONCURRENCY,
+    ):
+        self.company_id = company_id
+        self.maxsize = maxsize
+        self.concurrency = max(1, concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self.stats = {
+            "accepted": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+            "in_flight": 0,
+            "max_depth": 0,
+        }
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+
+    def submit(self, handler: Callable[[], Awaitable]) -> bool:
+        """Queue a handler; returns False when the company's queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(handler)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            logger.warning(
+                f"Inbound queue full for company {self.company_id}, "
+                f"dropping message ({self.stats['rejected']} dropped)"
+            )
+            return False
+        self.stats["accepted"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._queue.qsize())
+        return True
+
+    async def _worker(self):
+        while True:
+            handler = await self._queue.get()
+            self.stats["in_flight"] += 1
+            try:
+                await handler()
+                self.stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(
+                    f"Inbound handler failed for company {self.company_id}: {e}"
+                )
+            finally:
+                self.stats["in_flight"] -= 1
+                self._queue.task_done()
+
+    async def join(self):
+        """Wait until every queued message has been handled."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._workers = []
+        self._queue = None
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+class BotRuntime:
+    """
+    Runs the share of one platform's bots that hashes to this worker.
+    """
+
+    def __init__(
+        self,
+        platform: str,
+        manager,
+        worker_index: int = BOT_WORKER_INDEX,
+        worker_count: int = BOT_WORKERS,
+        cache=None,
+        lease_ttl: int = BOT_LEASE_TTL,
+        resync_interval: int = BOT_RESYNC_INTERVAL,
+        worker_id: str = None,
+    ):
+        self.platform = platform
+        self.manager = manager
+        self.worker_index = worker_index
+        self.worker_count = max(1, worker_count)
+        self.cache = cache or shared_cache
+        self.lease_ttl = lease_ttl
+        self.resync_interval = resync_interval
+        # Unique per process, so a restarted worker waits for its old leases
+        self.worker_id = worker_id or (
+            f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+        )
+        self.ring = HashRing([worker_index])
+        # Companies whose config can run a bot; decides server bot precedence
+        self.configured: set = set()
+        self._pending: Dict[str, dict] = {}
+        self._sync_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._subscription = None
+        self.running = False
+        self.stats = {
+            "rebalances": 0,
+            "events": 0,
+            "started": 0,
+            "stopped": 0,
+            "lease_conflicts": 0,
+            "leases_lost": 0,
+        }
+
+    # Keys
+
+    def lease_key(self, bot_id: str) -> str:
+        return f"bot_lease:{self.platform}:{bot_id}"
+
+    def heartbeat_key(self, worker_index: int) -> str:
+        return f"bot_worker:{self.platform}:{worker_index}"
+
+    # Membership
+
+    def heartbeat(self):
+        self.cache.set(
+            self.heartbeat_key(self.worker_index), self.worker_id, ttl=self.lease_ttl
+        )
+
+    def live_workers(self) -> List[int]:
+        return [
+            index
+            for index in range(self.worker_count)
+            if index == self.worker_index
+            or self.cache.exists(self.heartbeat_key(index))
+        ]
+
+    def refresh_ring(self) -> bool:
+        """Rebuild the ring from live workers; True if membership changed."""
+        workers = self.live_workers()
+        if workers == self.ring.nodes:
+            return False
+        logger.info(f"{self.platform} bot workers changed: {workers}")
+        self.ring = HashRing(workers)
+        return True
+
+    def assigned(self, bot_id: str) -> bool:
+        return self.ring.node_for(f"{self.platform}:{bot_id}") == self.worker_index
+
+    # Leases
+
+    def acquire(self, bot_id: str) -> bool:
+        key = self.lease_key(bot_id)
+        if self.cache.set_if_not_exists(key, self.worker_id, ttl=self.lease_ttl):
+            return True
+        return self.cache.set_if_equals(
+            key, self.worker_id, self.worker_id, ttl=self.lease_ttl
+        )
+
+    def release(self, bot_id: str):
+        self.cache.delete_if_equals(self.lease_key(bot_id), self.worker_id)
+
+    # Starting and stopping
+
+    async def _claim(self, bot_id: str, config: dict):
+        if bot_id in self.manager.bots:
+            return
+        in_backoff = getattr(self.manager, "_is_in_backoff", None)
+        if in_backoff and in_backoff(bot_id):
+            return
+        if not self.acquire(bot_id):
+            # The previous owner still holds it; retried on the next heartbeat
+            self.stats["lease_conflicts"] += 1
+            self._pending[bot_id] = config
+            return
+        self._pending.pop(bot_id, None)
+        if await self.manager.start_bot_from_config(bot_id, config):
+            self.stats["started"] += 1
+        else:
+            self.release(bot_id)
+
+    async def _drop(self, bot_id: str):
+        self._pending.pop(bot_id, None)
+        if bot_id in self.manager.bots:
+            await self.manager.stop_bot_for_company(bot_id)
+            self.stats["stopped"] += 1
+        self.release(bot_id)
+
+    async def rebalance(self):
+        """Full resync: start assigned bots and hand off the rest."""
+        async with self._sync_lock:
+            self.stats["rebalances"] += 1
+            self.refresh_ring()
+            configs = await asyncio.to_thread(self.manager.get_company_bot_config)
+            self.configured = {
+                company_id
+                for company_id, config in configs.items()
+                if self.manager.is_bot_runnable(config)
+            }
+            # Company bots take precedence over the shared server bot
+            wanted = {company_id: configs[company_id] for company_id in self.configured}
+            if not wanted:
+                server = await asyncio.to_thread(self.manager.get_server_bot_config)
+                if server:
+                    wanted[self.manager.SERVER_BOT_ID] = server
+
+            for bot_id in list(self.manager.bots.keys()):
+                if bot_id not in wanted or not self.assigned(bot_id):
+                    await self._drop(bot_id)
+            self._pending = {
+                bot_id: config
+                for bot_id, config in self._pending.items()
+                if bot_id in wanted and self.assigned(bot_id)
+            }
+            for bot_id, config in wanted.items():
+                if self.assigned(bot_id):
+                    await self._claim(bot_id, config)
+
+    async def apply_change(self, company_id: str):
+        """Apply one company's configuration change without a full resync."""
+        async with self._sync_lock:
+            self.stats["events"] += 1
+            configs = await asyncio.to_thread(
+                self.manager.get_company_bot_config, company_id
+            )
+            config = configs.get(company_id)
+            runnable = config is not None and self.manager.is_bot_runnable(config)
+            had_company_bots = bool(self.configured)
+            if runnable:
+                self.configured.add(company_id)
+            else:
+                self.configured.discard(company_id)
+            precedence_changed = had_company_bots != bool(self.configured)
+            if not precedence_changed:
+                # Restart so the bot picks up the new settings
+                if company_id in self.manager.bots or company_id in self._pending:
+                    await self._drop(company_id)
+                if runnable and self.assigned(company_id):
+                    await self._claim(company_id, config)
+                return
+        # The server bot starts or stops too, which needs every config
+        await self.rebalance()
+
+    async def tick(self):
+        """Heartbeat: renew leases, follow membership changes, retry claims."""
+        self.heartbeat()
+        for bot_id in list(self.manager.bots.keys()):
+            if not self.acquire(bot_id):
+                logger.warning(
+                    f"Lost the lease on {self.platform} bot {bot_id}, stopping it"
+                )
+                self.stats["leases_lost"] += 1
+                await self.manager.stop_bot_for_company(bot_id)
+        if self.refresh_ring():
+            await self.rebalance()
+            return
+        if self._pending:
+            async with self._sync_lock:
+                for bot_id, config in list(self._pending.items()):
+                    if self.assigned(bot_id):
+                        await self._claim(bot_id, config)
+                    else:
+                        self._pending.pop(bot_id, None)
+
+    async def handle_event(self, event: Optional[dict]):
+        if not isinstance(event, dict) or event.get("platform") != self.platform:
+            return
+        company_id = event.get("company_id")
+        if company_id:
+            await self.apply_change(str(company_id))
+
+    # Background loops
+
+    async def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.manager._running = True
+        if self.resync_interval > 60 and not getattr(
+            self.cache, "is_redis_available", True
+        ):
+            # Without Redis, events published by API workers never arrive here
+            self.resync_interval = 60
+        self.heartbeat()
+        self._subscription = self.cache.subscribe(BOT_CONFIG_CHANNEL)
+        await self.rebalance()
+        self._tasks = [
+            asyncio.create_task(self._heartbeat_loop()),
+            asyncio.create_task(self._event_loop()),
+        ]
+        if self.resync_interval > 0:
+            self._tasks.append(asyncio.create_task(self._resync_loop()))
+        logger.info(
+            f"{self.platform} bot runtime started as worker "
+            f"{self.worker_index + 1}/{self.worker_count}"
+        )
+
+    async def stop(self):
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks = []
+        if self._subscription is not None:
+            self._subscription.close()
+            self._subscription = None
+        for bot_id in list(self.manager.bots.keys()):
+            await self._drop(bot_id)
+        self.cache.delete_if_equals(
+            self.heartbeat_key(self.worker_index), self.worker_id
+        )
+        self.manager._running = False
+
+    async def _heartbeat_loop(self):
+        while self.running:
+            await asyncio.sleep(max(1, self.lease_ttl // 3))
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"{self.platform} bot heartbeat failed: {e}")
+
+    async def _event_loop(self):
+        while self.running:
+            try:
+                event = await asyncio.to_thread(self._subscription.get_message, 1.0)
+                if event is not None:
+                    await self.handle_event(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.platform} bot config event failed: {e}")
+                await asyncio.sleep(1)
+
+    async def _resync_loop(self):
+        while self.running:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                await self.rebalance()
+            except Exception as e:
+                logger.error(f"{self.platform} bot resync failed: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "platform": self.platform,
+            "worker_index": self.worker_index,
+            "worker_count": self.worker_count,
+            "live_workers": list(self.ring.nodes),
+            "running_bots": len(self.manager.bots),
+            "pending_bots": len(self._pending),
+        }
+
+
+async def run_bot_worker(platforms: List[str] = None):
+    """Run this process's share of the bots until cancelled."""
+    platforms = platforms or [
+        platform.strip()
+        for platform in os.getenv("BOT_PLATFORMS", ",".join(RUNTIME_PLATFORMS)).split(
+            ","
+        )
+        if platform.strip()
+    ]
+    stops = []
+    for platform in platforms:
+        if platform == "discord":
+            from DiscordBotManager import (
+                start_discord_bot_manager,
+                stop_discord_bot_manager,
+            )
+
+            await start_discord_bot_manager()
+            stops.append(stop_discord_bot_manager)
+        elif platform == "slack":
+            from SlackBotManager import start_slack_bot_manager, stop_slack_bot_manager
+
+            await start_slack_bot_manager()
+            stops.append(stop_slack_bot_manager)
+        elif platform == "teams":
+            from TeamsBotManager import start_teams_bot_manager, stop_teams_bot_manager
+
+            await start_teams_bot_manager()
+            stops.append(stop_teams_bot_manager)
+        else:
+            logger.warning(f"No sharded runtime for {platform} bots yet")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        for stop in stops:
+            await stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run_bot_worker())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,625 @@
+"""
+CodeIndex - Persistent per-workspace code search index
+
+The essential abilities coding commands (Grep Search, Search File Content,
+Find Symbol Usages, Create or Update Codebase Map) used to walk the workspace
+and read every file on every query. On real repositories an agent loop can
+issue dozens of these per turn, so the same files were read over and over.
+
+This module keeps one index per workspace directory for the lifetime of the
+worker process:
+
+- A trigram inverted index over the lowercased contents of every text file,
+  used to narrow literal and regex searches down to candidate files before
+  any line scanning happens.
+- A symbol table (functions, classes, methods, top-level assignments) built
+  with Python's ``ast`` for ``.py`` files and lightweight regex heuristics
+  for other languages.
+- Cached file lines and token counts so scans never touch the disk for
+  unchanged files.
+
+Updates are incremental: ``refresh()`` only stats the tree and re-reads files
+whose ``(mtime_ns, size)`` changed, and commands that write files call
+``notify_changed()`` / ``notify_deleted()`` so the index is updated without
+waiting for the next stat pass.
+
+Usage:
+    from CodeIndex import get_code_index
+
+    index = get_code_index(working_directory)
+    for rel_path, line_num, line in index.search("TODO", pattern="**/*.py"):
+        ...
+"""
+
+import ast
+import fnmatch
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+try:  # Python 3.11+
+    import re._parser as sre_parse
+    from re._constants import LITERAL, SUBPATTERN
+except ImportError:  # pragma: no cover - older interpreters
+    import sre_parse
+    from sre_constants import LITERAL, SUBPATTERN
+
+logger = logging.getLogger(__name__)
+
+# Extensions never indexed (mirrors the skip list used by the search commands)
+BINARY_EXTENSIONS = {
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".bmp",
+    ".ico",
+    ".webp",
+    ".svg",
+    ".mp3",
+    ".mp4",
+    ".wav",
+    ".avi",
+    ".mov",
+    ".mkv",
+    ".flac",
+    ".ogg",
+    ".zip",
+    ".tar",
+    ".gz",
+    ".rar",
+    ".7z",
+    ".bz2",
+    ".xz",
+    ".pdf",
+    ".doc",
+    ".docx",
+    ".xls",
+    ".xlsx",
+    ".ppt",
+    ".pptx",
+    ".exe",
+    ".dll",
+    ".so",
+    ".dylib",
+    ".bin",
+    ".pyc",
+    ".pyo",
+    ".class",
+    ".o",
+    ".obj",
+    ".db",
+    ".sqlite",
+    ".sqlite3",
+    ".woff",
+    ".woff2",
+    ".ttf",
+    ".eot",
+    ".otf",
+    ".icns",
+}
+
+# Version control internals, dependency trees and build output are never
+# useful search results (the same directories the old symbol walk pruned)
+SKIP_DIRS = {
+    ".git",
+    ".hg",
+    ".svn",
+    "node_modules",
+    "__pycache__",
+    "venv",
+    ".venv",
+    "dist",
+    "build",
+}
+
+# Files above this size are not cached in memory; they are always treated as
+# search candidates and read from disk when scanned.
+MAX_INDEXED_FILE_BYTES = 2 * 1024 * 1024
+
+# How many workspaces keep an index in memory per worker process
+MAX_CACHED_INDEXES = 16
+
+# Symbol heuristics for non-Python sources: (regex, kind)
+_GENERIC_SYMBOL_PATTERNS = [
+    (
+        re.compile(
+            r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\*?\s+([A-Za-z_$][\w$]*)"
+        ),
+        "function",
+    ),
+    (
+        re.compile(
+            r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)"
+        ),
+        "class",
+    ),
+    (
+        re.compile(r"^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*="),
+        "variable",
+    ),
+    (
+        re.compile(r"^\s*(?:export\s+)?(?:interface|type|enum)\s+([A-Za-z_$][\w$]*)"),
+        "type",
+    ),
+    (re.compile(r"^\s*func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)\s*\("), "function"),
+    (re.compile(r"^\s*type\s+([A-Za-z_]\w*)\s+(?:struct|interface)\b"), "type"),
+    (
+        re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+([A-Za-z_]\w*)"),
+        "function",
+    ),
+    (
+        re.compile(
+            r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|mod)\s+([A-Za-z_]\w*)"
+        ),
+        "type",
+    ),
+    (re.compile(r"^\s*def\s+([A-Za-z_]\w*[?!]?)"), "function"),
+    (
+        re.compile(
+            r"^\s*(?:(?:public|private|protected|internal|static|final|abstract|sealed|partial)\s+)*"
+            r"(?:class|interface|struct|record)\s+([A-Za-z_]\w*)"
+        ),
+        "class",
+    ),
+]
+
+_SCRIPT_EXTENSIONS = {
+    ".js",
+    ".jsx",
+    ".ts",
+    ".tsx",
+    ".mjs",
+    ".cjs",
+    ".vue",
+    ".svelte",
+    ".go",
+    ".rs",
+    ".rb",
+    ".java",
+    ".kt",
+    ".cs",
+    ".swift",
+    ".scala",
+    ".php",
+    ".c",
+    ".h",
+    ".cpp",
+    ".hpp",
+    ".cc",
+}
+
+
+@dataclass
+class IndexedFile:
+    """A single indexed file"""
+
+    rel_path: str
+    mtime_ns: int
+    size: int
+    lines: Optional[List[str]] = None  # None when the file is too large to cache
+    trigrams: Set[str] = field(default_factory=set)
+    symbols: List[Tuple[str, int, str]] = field(default_factory=list)
+    tokens: Optional[int] = None
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def split_lines(content: str) -> List[str]:
+    """
+    Split text the way ``readlines()`` does in universal newline mode.
+
+    ``str.splitlines`` also breaks on form feeds, vertical tabs and unicode
+    separators, which would shift line numbers relative to a plain read.
+    """
+    lines = [line + "\n" for line in content.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    Return lowercase literal substrings that every match of ``pattern`` must
+    contain. Only top-level literal runs are considered, so alternations and
+    optional groups never produce false negatives. Returns an empty list when
+    nothing can be guaranteed (the caller then scans every file).
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    literals = []
+    current = []
+
+    def flush():
+        if len(current) >= 3:
+            literals.append("".join(current).lower())
+        current.clear()
+
+    for op, value in parsed:
+        if op == LITERAL and value < 128:
+            current.append(chr(value))
+        elif op == SUBPATTERN and value[-1] is not None and len(value[-1]) == 1:
+            # A plain group containing a single literal: "(a)" still anchors a run
+            inner_op, inner_value = value[-1][0]
+            if inner_op == LITERAL and inner_value < 128:
+                current.append(chr(inner_value))
+            else:
+                flush()
+        else:
+            flush()
+    flush()
+    return literals
+
+
+def extract_symbols(rel_path: str, content: str) -> List[Tuple[str, int, str]]:
+    """
+    Extract ``(name, line, kind)`` definitions from a source file.
+
+    Python files are parsed with ``ast``; if parsing fails (or for any other
+    language) the regex heuristics are used instead.
+    """
+    ext = os.path.splitext(rel_path)[1].lower()
+    if ext == ".py":
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None:
+            symbols = []
+            # Definitions only live in statement bodies, so there is no need
+            # to visit every expression node the way ast.walk would.
+            stack = list(tree.body)
+            while stack:
+                node = stack.pop()
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    symbols.append((node.name, node.lineno, "function"))
+                elif isinstance(node, ast.ClassDef):
+                    symbols.append((node.name, node.lineno, "class"))
+                for attr in ("body", "orelse", "finalbody", "handlers"):
+                    children = getattr(node, attr, None)
+                    if isinstance(children, list):
+                        stack.extend(children)
+            for node in tree.body:
+                if isinstance(node, ast.Assign):
+                    for target in node.targets:
+                        if isinstance(target, ast.Name):
+                            symbols.append((target.id, node.lineno, "variable"))
+                elif isinstance(node, ast.AnnAssign) and isinstance(
+                    node.target, ast.Name
+                ):
+                    symbols.append((node.target.id, node.lineno, "variable"))
+            symbols.sort(key=lambda s: s[1])
+            return symbols
+    elif ext not in _SCRIPT_EXTENSIONS:
+        return []
+    symbols = []
+    for line_num, line in enumerate(content.split("\n"), 1):
+        for regex, kind in _GENERIC_SYMBOL_PATTERNS:
+            match = regex.match(line)
+            if match:
+                symbols.append((match.group(1), line_num, kind))
+                break
+    return symbols
+
+
+def matches_glob(rel_path: str, pattern: str) -> bool:
+    """Glob matching with the same semantics the search commands have always used"""
+    filename = rel_path.rsplit("/", 1)[-1]
+    return fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(
+        filename, pattern.split("/")[-1] if "/" in pattern else pattern
+    )
+
+
+class CodeIndex:
+    """
+    Incrementally maintained trigram + symbol index for one workspace.
+
+    All public methods are thread-safe. Search results are yielded in the
+    same order ``os.walk`` would visit the files, so callers that truncate at
+    ``max_results`` return exactly what a full walk would have returned.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self._lock = threading.RLock()
+        self._files: Dict[str, IndexedFile] = {}
+        self._order: List[str] = []
+        self._postings: Dict[str, Set[str]] = {}
+        self._unindexed: Set[str] = set()  # too large to cache
+        self._symbols: Dict[str, List[Tuple[str, int, str]]] = {}
+        self._last_refresh = 0.0
+        self.stats = {
+            "refreshes": 0,
+            "files_read": 0,
+            "files_removed": 0,
+            "queries": 0,
+            "candidates_scanned": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def _rel(self, path: str) -> str:
+        if os.path.isabs(path):
+            path = os.path.relpath(os.path.realpath(path), self.root)
+        return path.replace(os.sep, "/")
+
+    def _walk(self) -> Iterable[Tuple[str, str]]:
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+            rel_root = os.path.relpath(dirpath, self.root)
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() in BINARY_EXTENSIONS:
+                    continue
+                rel_path = (
+                    filename
+                    if rel_root == "."
+                    else f"{rel_root.replace(os.sep, '/')}/{filename}"
+                )
+                yield rel_path, os.path.join(dirpath, filename)
+
+    def _drop(self, rel_path: str) -> None:
+        entry = self._files.pop(rel_path, None)
+        if entry is None:
+            return
+        for gram in entry.trigrams:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(rel_path)
+                if not posting:
+                    del self._postings[gram]
+        for name, _, _ in entry.symbols:
+            defs = self._symbols.get(name)
+            if defs:
+                defs[:] = [d for d in defs if d[0] != rel_path]
+                if not defs:
+                    del self._symbols[name]
+        self._unindexed.discard(rel_path)
+        self.stats["files_removed"] += 1
+
+    def _load(self, rel_path: str, full_path: str, st: os.stat_result) -> None:
+        self._drop(rel_path)
+        entry = IndexedFile(rel_path=rel_path, mtime_ns=st.st_mtime_ns, size=st.st_size)
+        if st.st_size > MAX_INDEXED_FILE_BYTES:
+            self._unindexed.add(rel_path)
+        else:
+            try:
+                with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
+                    content = f.read()
+            except OSError:
+                return
+            entry.lines = split_lines(content)
+            entry.trigrams = _trigrams(content.lower())
+            for gram in entry.trigrams:
+                self._postings.setdefault(gram, set()).add(rel_path)
+            entry.symbols = extract_symbols(rel_path, content)
+            for name, line_num, kind in entry.symbols:
+                self._symbols.setdefault(name, []).append((rel_path, line_num, kind))
+        self._files[rel_path] = entry
+        self.stats["files_read"] += 1
+
+    def refresh(self) -> None:
+        """Stat the workspace and re-index files whose mtime or size changed."""
+        with self._lock:
+            seen = set()
+            order = []
+            for rel_path, full_path in self._walk():
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                seen.add(rel_path)
+                order.append(rel_path)
+                entry = self._files.get(rel_path)
+                if (
+                    entry is None
+                    or entry.mtime_ns != st.st_mtime_ns
+                    or entry.size != st.st_size
+                ):
+                    self._load(rel_path, full_path, st)
+            for rel_path in [p for p in self._files if p not in seen]:
+                self._drop(rel_path)
+            self._order = order
+            self._last_refresh = time.time()
+            self.stats["refreshes"] += 1
+
+    def notify_changed(self, paths) -> None:
+        """Re-index specific files right away (absolute or workspace-relative paths)."""
+        if isinstance(paths, str):
+            paths = [paths]
+        with self._lock:
+            for path in paths:
+                rel_path = self._rel(path)
+                full_path = os.path.join(self.root, rel_path)
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    self._drop(rel_path)
+                    if rel_path in self._order:
+                        self._order.remove(rel_path)
+                    continue
+                if os.path.splitext(rel_path)[1].lower() in BINARY_EXTENSIONS:
+                    continue
+                if rel_path not in self._files and rel_path not in self._order:
+                    self._order.append(rel_path)
+                self._load(rel_path, full_path, st)
+
+    def notify_deleted(self, paths) -> None:
+        """Remove specific files from the index."""
+        if isinstance(paths, str):
+            paths = [paths]
+        with self._lock:
+            for path in paths:
+                rel_path = self._rel(path)
+                self._drop(rel_path)
+                if rel_path in self._order:
+                    self._order.remove(rel_path)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _candidates(self, literals: List[str]) -> Optional[Set[str]]:
+        """Files that contain every literal, or None if no filtering is possible."""
+        grams = set()
+        for literal in literals:
+            grams |= _trigrams(literal)
+        if not grams:
+            return None
+        postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result &= posting
+        return result | self._unindexed
+
+    def candidate_files(
+        self,
+        literals: Optional[List[str]] = None,
+        pattern: str = "**/*",
+        prefix: str = "",
+        refresh: bool = True,
+    ) -> List[str]:
+        """Workspace-relative paths (in walk order) that may contain all literals."""
+        if refresh:
+            self.refresh()
+        with self._lock:
+            candidates = self._candidates(literals or [])
+            if prefix:
+                prefix = prefix.strip("/") + "/"
+            return [
+                rel_path
+                for rel_path in self._order
+                if (candidates is None or rel_path in candidates)
+                and (not prefix or rel_path.startswith(prefix))
+                and (pattern in ("", "**/*") or matches_glob(rel_path, pattern))
+            ]
+
+    def get_lines(self, rel_path: str) -> List[str]:
+        """Lines of a file (with line endings), served from the cache when possible."""
+        with self._lock:
+            entry = self._files.get(rel_path)
+            if entry is not None and entry.lines is not None:
+                return entry.lines
+        with open(
+            os.path.join(self.root, rel_path), "r", encoding="utf-8", errors="ignore"
+        ) as f:
+            return f.readlines()
+
+    def get_text(self, rel_path: str) -> str:
+        return "".join(self.get_lines(rel_path))
+
+    def get_tokens(self, rel_path: str, token_counter: Callable[[str], int]) -> int:
+        """Token count for a file, cached until the file changes."""
+        with self._lock:
+            entry = self._files.get(rel_path)
+            if entry is not None and entry.tokens is not None:
+                return entry.tokens
+        tokens = token_counter(self.get_text(rel_path))
+        with self._lock:
+            entry = self._files.get(rel_path)
+            if entry is not None:
+                entry.tokens = tokens
+        return tokens
+
+    def search(
+        self,
+        query: str,
+        pattern: str = "**/*",
+        is_regex: bool = False,
+        prefix: str = "",
+        refresh: bool = True,
+    ) -> Iterable[Tuple[str, int, str]]:
+        """
+        Yield ``(rel_path, line_num, line)`` for every matching line.
+
+        Literal queries are case-insensitive substring matches; regex queries
+        are compiled with ``re.IGNORECASE``. ``line`` keeps its line ending.
+        """
+        if is_regex:
+            regex = re.compile(query, re.IGNORECASE)
+            literals = required_literals(query)
+            matcher = regex.search
+        else:
+            needle = query.lower()
+            literals = [needle]
+            matcher = lambda line: needle in line.lower()
+        files = self.candidate_files(literals, pattern, prefix, refresh=refresh)
+        self.stats["queries"] += 1
+        for rel_path in files:
+            self.stats["candidates_scanned"] += 1
+            try:
+                lines = self.get_lines(rel_path)
+            except OSError:
+                continue
+            for line_num, line in enumerate(lines, 1):
+                if matcher(line):
+                    yield rel_path, line_num, line
+
+    def find_definitions(
+        self, name: str, refresh: bool = True
+    ) -> List[Tuple[str, int, str]]:
+        """``(rel_path, line, kind)`` definition sites for a symbol name."""
+        if refresh:
+            self.refresh()
+        with self._lock:
+            return list(self._symbols.get(name, []))
+
+    def get_version(self, rel_path: str) -> Optional[Tuple[int, int]]:
+        """``(mtime_ns, size)`` of the indexed copy of a file, or None if unknown."""
+        with self._lock:
+            entry = self._files.get(rel_path)
+            return (entry.mtime_ns, entry.size) if entry is not None else None
+
+    def get_symbols(self, rel_path: str) -> List[Tuple[str, int, str]]:
+        with self._lock:
+            entry = self._files.get(rel_path)
+            return list(entry.symbols) if entry is not None else []
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "files": len(self._files),
+                "unindexed_files": len(self._unindexed),
+                "trigrams": len(self._postings),
+                "symbols": len(self._symbols),
+                "last_refresh": self._last_refresh,
+            }
+
+
+_indexes: "OrderedDict[str, CodeIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_code_index(root: str) -> CodeIndex:
+    """Get (or create) the index for a workspace directory."""
+    key = os.path.realpath(root)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = CodeIndex(key)
+            _indexes[key] = index
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
+
+
+def drop_code_index(root: str) -> None:
+    """Forget the index for a workspace (e.g. when the workspace is deleted)."""
+    with _indexes_lock:
+        _indexes.pop(os.path.realpath(root), None)
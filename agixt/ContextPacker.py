@@ -0,0 +1,378 @@
+"""
+ContextPacker - Deterministic token budgeting for format_prompt
+
+format_prompt gathers memories, conversation history, activities, the
+conversation summary, user knowledge, uploaded and imported files and more.
+Before this module, once all of that passed max_context_tokens the whole set
+went to Interactions.reduce_context. That meant several extra LLM calls on
+the critical path of every long conversation.
+
+The packer fits the sections into the budget without a model:
+
+1. The prompt template, the user input and the commands are fixed costs.
+2. Sections that cannot be cut item by item (`TRIM_NONE`) are kept whole.
+3. Each trimmable section is guaranteed `share` of the budget, or what it
+   needs if that is less. What is left goes to sections in priority order.
+4. A section is trimmed to its grant by dropping items. `TRIM_SCORE`
+   sections, such as ranked memories, drop their lowest-scored items.
+   `TRIM_OLDEST` sections, such as history and activities, drop their
+   oldest items.
+5. Budget left unused by coarse items is offered again in priority order.
+
+Only when the untrimmable sections alone do not fit does the report set
+`needs_reduction`. format_prompt then falls back to the LLM reducer.
+
+Token counts are cached by content hash. A long conversation re-packs the
+same interactions every turn, so most counts are cache hits.
+
+    packer = ContextPacker()
+    texts, report = packer.pack(sections, budget=24000, fixed_tokens=3100)
+    logging.info(report.summary())
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRIM_SCORE = "score"
+TRIM_OLDEST = "oldest"
+TRIM_NONE = "none"
+
+# Token counts remembered across turns
+TOKEN_CACHE_SIZE = 50000
+
+
+@dataclass
+class ContextItem:
+    text: str
+    # Higher scores survive trimming longer (TRIM_SCORE sections)
+    score: float = 0.0
+    tokens: Optional[int] = None
+
+
+@dataclass
+class ContextSection:
+    """
+    A named block of the prompt context. Items render in the order given,
+    joined by `separator` and wrapped in `prefix` and `suffix` when any
+    item is kept. For TRIM_OLDEST sections items are oldest first.
+    """
+
+    name: str
+    items: List[ContextItem] = field(default_factory=list)
+    # Lower numbers get leftover budget first
+    priority: int = 5
+    # Fraction of the available budget reserved for this section
+    share: float = 0.0
+    trim: str = TRIM_SCORE
+    separator: str = "\n"
+    prefix: str = ""
+    suffix: str = ""
+
+    @classmethod
+    def text(cls, name: str, text: str, **kwargs) -> "ContextSection":
+        """A section with one untrimmable item"""
+        kwargs.setdefault("trim", TRIM_NONE)
+        return cls(name=name, items=[ContextItem(text)] if text else [], **kwargs)
+
+    def render(self, items: Optional[Sequence[ContextItem]] = None) -> str:
+        items = self.items if items is None else items
+        if not items:
+            return ""
+        return (
+            self.prefix + self.separator.join(item.text for item in items) + self.suffix
+        )
+
+
+@dataclass
+class SectionReport:
+    name: str
+    priority: int
+    trim: str
+    tokens: int
+    kept_tokens: int
+    items: int
+    kept_items: int
+    grant: Optional[int] = None
+
+    @property
+    def trimmed(self) -> bool:
+        return self.kept_items < self.items
+
+
+@dataclass
+class PackingReport:
+    budget: int
+    fixed_tokens: int
+    sections: List[SectionReport] = field(default_factory=list)
+    # Everything fit before any trimming
+    fits: bool = True
+    # Untrimmable sections alone exceed the budget; the LLM reducer is needed
+    needs_reduction: bool = False
+    llm_reduction: bool = False
+    elapsed_ms: float = 0.0
+    counted: int = 0
+    cache_hits: int = 0
+
+    @property
+    def tokens(self) -> int:
+        return self.fixed_tokens + sum(section.kept_tokens for section in self.sections)
+
+    @property
+    def original_tokens(self) -> int:
+        return self.fixed_tokens + sum(section.tokens for section in self.sections)
+
+    def summary(self) -> str:
+        """One log line explaining what was kept and why"""
+        parts = []
+        for section in self.sections:
+            if not section.items:
+                continue
+            part = f"{section.name} p{section.priority} {section.tokens}"
+            if section.trimmed:
+                part += (
+                    f"->{section.kept_tokens} ({section.kept_items}/{section.items} "
+                    f"kept, grant {section.grant}, by {section.trim})"
+                )
+            parts.append(part)
+        outcome = "fits" if self.fits else "packed"
+        if self.needs_reduction:
+            outcome = "llm reduction" if self.llm_reduction else "over budget"
+        return (
+            f"[context_packer] {outcome}: {self.original_tokens} -> {self.tokens} "
+            f"of {self.budget} tokens (fixed {self.fixed_tokens}) in "
+            f"{self.elapsed_ms:.1f} ms, {self.cache_hits}/{self.counted} counts "
+            f"cached; " + ", ".join(parts)
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "budget": self.budget,
+            "fixed_tokens": self.fixed_tokens,
+            "original_tokens": self.original_tokens,
+            "tokens": self.tokens,
+            "fits": self.fits,
+            "needs_reduction": self.needs_reduction,
+            "llm_reduction": self.llm_reduction,
+            "elapsed_ms": round(self.elapsed_ms, 2),
+            "sections": [
+                {
+                    "name": section.name,
+                    "priority": section.priority,
+                    "trim": section.trim,
+                    "tokens": section.tokens,
+                    "kept_tokens": section.kept_tokens,
+                    "items": section.items,
+                    "kept_items": section.kept_items,
+                    "grant": section.grant,
+                }
+                for section in self.sections
+            ],
+        }
+
+
+def _default_count_tokens(text: str) -> int:
+    from Globals import get_tokens
+
+    return get_tokens(text)
+
+
+def _keep_by_score(items: List[ContextItem], grant: int) -> List[int]:
+    """Indexes of the best-scored items that fit, in their original order"""
+    kept = []
+    remaining = grant
+    order = sorted(range(len(items)), key=lambda index: -items[index].score)
+    for index in order:
+        if items[index].tokens <= remaining:
+            kept.append(index)
+            remaining -= items[index].tokens
+    return sorted(kept)
+
+
+def _keep_newest(items: List[ContextItem], grant: int) -> List[int]:
+    """Indexes of the newest contiguous run of items that fits"""
+    remaining = grant
+    start = len(items)
+    while start > 0 and items[start - 1].tokens <= remaining:
+        start -= 1
+        remaining -= items[start].tokens
+    return list(range(start, len(items)))
+
+
+class ContextPacker:
+    def __init__(
+        self,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        cache_size: int = TOKEN_CACHE_SIZE,
+    ):
+        self.count_tokens = count_tokens or _default_count_tokens
+        self.cache_size = cache_size
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "turns": 0,
+            "trimmed_turns": 0,
+            "llm_reductions": 0,
+            "packing_ms": 0.0,
+        }
+
+    def count(self, text: str) -> int:
+        return self._count(text)[0]
+
+    def _count(self, text: str) -> Tuple[int, bool]:
+        if not text:
+            return 0, True
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key], True
+        tokens = self.count_tokens(text)
+        with self._lock:
+            self._counts[key] = tokens
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return tokens, False
+
+    def pack(
+        self,
+        sections: Sequence[ContextSection],
+        budget: int,
+        fixed_tokens: int = 0,
+    ) -> Tuple[Dict[str, str], PackingReport]:
+        """
+        Fit `sections` into `budget` tokens minus `fixed_tokens`.
+
+        Returns the rendered text of every section by name and the report.
+        """
+        start = time.perf_counter()
+        report = PackingReport(budget=budget, fixed_tokens=fixed_tokens)
+        for section in sections:
+            for item in section.items:
+                if item.tokens is None:
+                    item.tokens, hit = self._count(item.text)
+                    report.counted += 1
+                    report.cache_hits += hit
+        overhead = {}
+        for section in sections:
+            if section.items and (section.prefix or section.suffix):
+                overhead[section.name], hit = self._count(
+                    section.prefix + section.suffix
+                )
+                report.counted += 1
+                report.cache_hits += hit
+        need = {
+            section.name: overhead.get(section.name, 0)
+            + sum(item.tokens for item in section.items)
+            for section in sections
+        }
+        available = max(0, budget - fixed_tokens)
+        kept = {section.name: list(range(len(section.items))) for section in sections}
+        grants: Dict[str, int] = {}
+        report.fits = sum(need.values()) <= available
+        trimmable = sorted(
+            (
+                section
+                for section in sections
+                if section.trim != TRIM_NONE and section.items
+            ),
+            key=lambda section: section.priority,
+        )
+        if not report.fits and trimmable:
+            untrimmable = sum(
+                need[section.name] for section in sections if section.trim == TRIM_NONE
+            )
+            for section in trimmable:
+                grants[section.name] = min(
+                    need[section.name], int(section.share * available)
+                )
+            leftover = available - untrimmable - sum(grants.values())
+            for section in trimmable:
+                extra = max(0, min(need[section.name] - grants[section.name], leftover))
+                grants[section.name] += extra
+                leftover -= extra
+
+            def trim(section: ContextSection, grant: int) -> int:
+                budget_for_items = max(0, grant - overhead.get(section.name, 0))
+                keep = _keep_newest if section.trim == TRIM_OLDEST else _keep_by_score
+                kept[section.name] = keep(section.items, budget_for_items)
+                return self._kept_tokens(section, kept[section.name], overhead)
+
+            used = {
+                section.name: trim(section, grants[section.name])
+                for section in trimmable
+            }
+            # Coarse items leave part of a grant unused; offer it again
+            unused = available - untrimmable - sum(used.values())
+            for section in trimmable:
+                if unused <= 0:
+                    break
+                if len(kept[section.name]) == len(section.items):
+                    continue
+                grants[section.name] = used[section.name] + unused
+                before = used[section.name]
+                used[section.name] = trim(section, grants[section.name])
+                unused -= used[section.name] - before
+        for section in sections:
+            report.sections.append(
+                SectionReport(
+                    name=section.name,
+                    priority=section.priority,
+                    trim=section.trim,
+                    tokens=need[section.name],
+                    kept_tokens=self._kept_tokens(
+                        section, kept[section.name], overhead
+                    ),
+                    items=len(section.items),
+                    kept_items=len(kept[section.name]),
+                    grant=grants.get(section.name),
+                )
+            )
+        report.needs_reduction = report.tokens > budget
+        report.elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats["turns"] += 1
+        self.stats["trimmed_turns"] += not report.fits
+        self.stats["packing_ms"] += report.elapsed_ms
+        texts = {
+            section.name: section.render(
+                [section.items[index] for index in kept[section.name]]
+            )
+            for section in sections
+        }
+        return texts, report
+
+    @staticmethod
+    def _kept_tokens(
+        section: ContextSection, indexes: List[int], overhead: Dict[str, int]
+    ) -> int:
+        if not indexes:
+            return 0
+        return overhead.get(section.name, 0) + sum(
+            section.items[index].tokens for index in indexes
+        )
+
+    def record_llm_reduction(self, report: PackingReport):
+        report.llm_reduction = True
+        self.stats["llm_reductions"] += 1
+
+    def get_stats(self) -> dict:
+        turns = self.stats["turns"]
+        return {
+            **self.stats,
+            "llm_reduction_rate": (
+                round(self.stats["llm_reductions"] / turns, 4) if turns else 0.0
+            ),
+            "avg_packing_ms": (
+                round(self.stats["packing_ms"] / turns, 3) if turns else 0.0
+            ),
+            "cached_token_counts": len(self._counts),
+        }
+
+
+context_packer = ContextPacker()
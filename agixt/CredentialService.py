@@ -0,0 +1,361 @@
+"""
+CredentialService - Password hashing off the request path, with admission control
+
+Argon2id with a 64 MB memory cost used to run inside the request handlers of
+login, registration and password changes, mostly on the event loop. A burst
+of logins stalled every other request the worker was serving, and with
+enough threads it could use up the worker's memory.
+
+Here:
+
+- Hashes are computed and verified in a process pool. The pool is sized so
+  that concurrent hashes use at most PASSWORD_HASH_MEMORY_FRACTION of the
+  available memory, and never more workers than CPUs.
+- Only a bounded number of hashes may wait for a worker. Beyond that the
+  caller gets 429 with Retry-After at once, so an overload costs no memory
+  or CPU.
+- `check_login` applies per-IP and per-account token buckets, shared
+  through SharedCache, before any database or hashing work. The FailedLogins
+  24 hour lockout in MagicalAuth remains the durable limit behind them.
+- `verify` also reports when a hash was made with other parameters, so
+  callers can rehash it on the next successful login.
+
+    credential_service.check_login(client_ip, username)
+    ok, needs_rehash = await credential_service.verify(password, user.password_hash)
+"""
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import astuple, dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import argon2
+from fastapi import HTTPException
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Argon2id parameters for new hashes. Hashes made with other parameters
+# still verify and are rehashed on the next successful login.
+PASSWORD_HASH_TIME_COST = int(os.getenv("PASSWORD_HASH_TIME_COST", "2"))
+PASSWORD_HASH_MEMORY_COST = int(os.getenv("PASSWORD_HASH_MEMORY_COST", "65536"))
+# Share of the available memory concurrent hashes may use
+PASSWORD_HASH_MEMORY_FRACTION = float(
+    os.getenv("PASSWORD_HASH_MEMORY_FRACTION", "0.25")
+)
+# Worker processes; 0 sizes the pool from CPUs and available memory
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))
+# Hashes allowed to wait per worker before new ones are refused with 429
+PASSWORD_HASH_QUEUE_PER_WORKER = int(os.getenv("PASSWORD_HASH_QUEUE_PER_WORKER", "4"))
+
+# Login attempts: burst size and sustained rate per client IP and per account
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "20"))
+LOGIN_ACCOUNT_BURST = int(os.getenv("LOGIN_ACCOUNT_BURST", "5"))
+LOGIN_ACCOUNT_PER_MINUTE = float(os.getenv("LOGIN_ACCOUNT_PER_MINUTE", "2"))
+
+# Memory of a spawned worker besides the Argon2 buffer
+WORKER_OVERHEAD_BYTES = 40 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class HashParameters:
+    time_cost: int = PASSWORD_HASH_TIME_COST
+    # KiB
+    memory_cost: int = PASSWORD_HASH_MEMORY_COST
+    parallelism: int = 1
+    hash_len: int = 32
+    salt_len: int = 16
+
+    def hasher(self) -> argon2.PasswordHasher:
+        return argon2.PasswordHasher(
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+            hash_len=self.hash_len,
+            salt_len=self.salt_len,
+            type=argon2.Type.ID,
+        )
+
+
+# Hashers of a pool worker, by parameters
+_hashers: Dict[tuple, argon2.PasswordHasher] = {}
+
+
+def _get_hasher(params: tuple) -> argon2.PasswordHasher:
+    if params not in _hashers:
+        _hashers[params] = HashParameters(*params).hasher()
+    return _hashers[params]
+
+
+def _hash_password(password: str, params: tuple) -> str:
+    """Runs in a pool worker"""
+    return _get_hasher(params).hash(password)
+
+
+def _verify_password(
+    password_hash: str, password: str, params: tuple
+) -> Tuple[bool, bool]:
+    """(matches, needs_rehash); runs in a pool worker"""
+    hasher = _get_hasher(params)
+    try:
+        hasher.verify(password_hash, password)
+    except argon2.exceptions.VerifyMismatchError:
+        return False, False
+    except (argon2.exceptions.InvalidHash, argon2.exceptions.VerificationError):
+        logger.error("Password verification error: invalid hash format")
+        return False, False
+    return True, hasher.check_needs_rehash(password_hash)
+
+
+def size_workers(
+    memory_cost_kib: int = PASSWORD_HASH_MEMORY_COST,
+    memory_fraction: float = PASSWORD_HASH_MEMORY_FRACTION,
+    available_bytes: Optional[int] = None,
+    cpus: Optional[int] = None,
+) -> int:
+    """Workers whose concurrent hashes fit in `memory_fraction` of free memory"""
+    if available_bytes is None:
+        import psutil
+
+        available_bytes = psutil.virtual_memory().available
+    cpus = cpus or os.cpu_count() or 1
+    per_worker = memory_cost_kib * 1024 + WORKER_OVERHEAD_BYTES
+    return max(1, min(cpus, int(available_bytes * memory_fraction // per_worker)))
+
+
+def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class TokenBucket:
+    """
+    A token bucket per key, kept in the shared cache so all workers draw
+    from it. Updates are not atomic; under a race a few extra attempts may
+    get through, which is fine for throttling.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        burst: int,
+        per_minute: float,
+        cache=None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.cache = cache or shared_cache
+        self.clock = clock
+
+    def _key(self, key: str) -> str:
+        return f"login_bucket:{self.name}:{key}"
+
+    def take(self, key: str) -> float:
+        """Take a token; returns 0 or the seconds until one is available"""
+        now = self.clock()
+        state = self.cache.get(self._key(key))
+        tokens = float(self.burst)
+        if state is not None:
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+        # Expires once the bucket would have refilled anyway
+        ttl = math.ceil((self.burst - tokens + 1) / self.rate) + 1
+        self.cache.set(self._key(key), [tokens - 1, now], ttl=ttl)
+        return 0.0
+
+    def reset(self, key: str):
+        self.cache.delete(self._key(key))
+
+
+class CredentialService:
+    def __init__(
+        self,
+        params: Optional[HashParameters] = None,
+        workers: int = PASSWORD_HASH_WORKERS,
+        queue_per_worker: int = PASSWORD_HASH_QUEUE_PER_WORKER,
+        ip_bucket: Optional[TokenBucket] = None,
+        account_bucket: Optional[TokenBucket] = None,
+    ):
+        self.params = params or HashParameters()
+        self.workers = workers or size_workers(self.params.memory_cost)
+        self.max_pending = self.workers * (1 + queue_per_worker)
+        self.ip_bucket = ip_bucket or TokenBucket(
+            "ip", LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE
+        )
+        self.account_bucket = account_bucket or TokenBucket(
+            "account", LOGIN_ACCOUNT_BURST, LOGIN_ACCOUNT_PER_MINUTE
+        )
+        self._hasher = self.params.hasher()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.stats = {
+            "hashes": 0,
+            "verifications": 0,
+            "rehashes_needed": 0,
+            "busy_rejections": 0,
+            "throttled_ip": 0,
+            "throttled_account": 0,
+            "latency_seconds": 0.0,
+        }
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def saturated(self) -> bool:
+        return self._pending >= self.max_pending
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking a threaded server can deadlock the child, so spawn
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _busy(self) -> HTTPException:
+        self.stats["busy_rejections"] += 1
+        # A full queue drains in about this long at ~250 ms per hash
+        return too_many_requests(
+            "Authentication service is busy. Please try again shortly.",
+            self.max_pending / self.workers * 0.25,
+        )
+
+    def _submit(self, stat: str, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise self._busy()
+            self._pending += 1
+            submitted = False
+            try:
+                try:
+                    future = self._get_pool().submit(fn, *args)
+                except BrokenProcessPool:
+                    logger.warning("Password hashing pool failed, restarting it")
+                    self._pool = None
+                    future = self._get_pool().submit(fn, *args)
+                submitted = True
+            finally:
+                if not submitted:
+                    self._pending -= 1
+        start = time.perf_counter()
+
+        def done(_):
+            with self._lock:
+                self._pending -= 1
+            self.stats[stat] += 1
+            self.stats["latency_seconds"] += time.perf_counter() - start
+
+        future.add_done_callback(done)
+        return future
+
+    def check_login(self, ip_address: Optional[str], account: Optional[str]):
+        """
+        Raise 429 when the pool is saturated or the client IP or account is
+        out of attempts. Call before any database or hashing work.
+        """
+        if self.saturated:
+            raise self._busy()
+        if ip_address:
+            wait = self.ip_bucket.take(ip_address)
+            if wait:
+                self.stats["throttled_ip"] += 1
+                raise too_many_requests(
+                    "Too many login attempts. Please try again later.", wait
+                )
+        if account:
+            wait = self.account_bucket.take(account.strip().lower())
+            if wait:
+                self.stats["throttled_account"] += 1
+                raise too_many_requests(
+                    "Too many login attempts for this account. Please try again later.",
+                    wait,
+                )
+
+    def record_login_success(self, account: Optional[str]):
+        """A successful login gives the account its full burst back"""
+        if account:
+            self.account_bucket.reset(account.strip().lower())
+
+    def _verify_future(self, password: str, password_hash: str) -> Future:
+        return self._submit(
+            "verifications",
+            _verify_password,
+            password_hash,
+            password,
+            astuple(self.params),
+        )
+
+    def _note_rehash(self, result: Tuple[bool, bool]) -> Tuple[bool, bool]:
+        if result[1]:
+            self.stats["rehashes_needed"] += 1
+        return result
+
+    async def verify(self, password: str, password_hash: str) -> Tuple[bool, bool]:
+        """(matches, needs_rehash) for `password` against `password_hash`"""
+        if not password_hash or password is None:
+            return False, False
+        result = await asyncio.wrap_future(self._verify_future(password, password_hash))
+        return self._note_rehash(result)
+
+    async def hash(self, password: str) -> str:
+        future = self._submit("hashes", _hash_password, password, astuple(self.params))
+        return await asyncio.wrap_future(future)
+
+    def verify_sync(self, password: str, password_hash: str) -> Tuple[bool, bool]:
+        """`verify` for code running in a thread; blocks until done"""
+        if not password_hash or password is None:
+            return False, False
+        return self._note_rehash(self._verify_future(password, password_hash).result())
+
+    def hash_sync(self, password: str) -> str:
+        """`hash` for code running in a thread; blocks until done"""
+        return self._submit(
+            "hashes", _hash_password, password, astuple(self.params)
+        ).result()
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        try:
+            return self._hasher.check_needs_rehash(password_hash)
+        except argon2.exceptions.InvalidHash:
+            return True
+
+    def get_stats(self) -> dict:
+        done = self.stats["hashes"] + self.stats["verifications"]
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            # Includes time spent waiting for a worker
+            "avg_latency_ms": (
+                round(self.stats["latency_seconds"] / done * 1000, 2) if done else 0.0
+            ),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+credential_service = CredentialService()
@@ -10,6 +10,7 @@ from sqlalchemy import (
     Text,
     String,
     Integer,
+    BigInteger,
     ForeignKey,
     DateTime,
     Boolean,
@@ -28,6 +29,11 @@ from sqlalchemy.types import TypeDecorator, VARCHAR
 from sqlalchemy.sql.sqltypes import ARRAY, Float
 from cryptography.fernet import Fernet
 from Globals import getenv
+from HybridRetrieval import (
+    apply_memory_filters,
+    ensure_memory_text_index,
+    rank_by_similarity,
+)
 import numpy as np
 
 
@@ -514,6 +520,9 @@ class Company(Base):
     icon_url = Column(
         String, nullable=True, default=None
     )  # Group icon/avatar image URL (like Discord server icon)
+    billing_version = Column(
+        Integer, nullable=True, default=0
+    )  # Bumped on every billing change; versions cached entitlements
     users = relationship("UserCompany", back_populates="company")
 
     @classmethod
@@ -548,6 +557,55 @@ class CompanyTokenUsage(Base):
     output_tokens = Column(Integer, nullable=False, default=0)
     total_tokens = Column(Integer, nullable=False, default=0)
     timestamp = Column(DateTime, nullable=False, default=datetime.now)
+    # Agent that used the tokens, when known
+    agent_id = Column(String, nullable=True)
+    # Whether this row is counted in usage_rollup; the backfill rolls up the rest
+    rolled_up = Column(Boolean, nullable=True, default=False)
+
+
+class UsageRollup(Base):
+    """
+    Token usage per hour, day and all time for each company, user and agent,
+    kept up to date as usage is recorded (see BillingAnalytics)
+    """
+
+    __tablename__ = "usage_rollup"
+    id = Column(
+        UUID(as_uuid=True) if DATABASE_TYPE != "sqlite" else String,
+        primary_key=True,
+        default=get_new_id if DATABASE_TYPE == "sqlite" else uuid.uuid4,
+    )
+    # hour, day or all
+    granularity = Column(String, nullable=False)
+    # company, user or agent
+    scope = Column(String, nullable=False)
+    subject_id = Column(String, nullable=False)
+    # Company the usage was billed to, "" when the user had none
+    company_id = Column(String, nullable=False, default="")
+    bucket_start = Column(DateTime, nullable=False)
+    input_tokens = Column(BigInteger, nullable=False, default=0)
+    output_tokens = Column(BigInteger, nullable=False, default=0)
+    total_tokens = Column(BigInteger, nullable=False, default=0)
+    usage_count = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity",
+            "scope",
+            "subject_id",
+            "company_id",
+            "bucket_start",
+            name="uq_usage_rollup_key",
+        ),
+        Index("ix_usage_rollup_bucket", "granularity", "scope", "bucket_start"),
+        Index(
+            "ix_usage_rollup_company",
+            "granularity",
+            "scope",
+            "company_id",
+            "bucket_start",
+        ),
+    )
 
 
 class UserCompany(Base):
@@ -2605,6 +2663,11 @@ class Memory(Base):
     description = Column(Text)
     timestamp = Column(DateTime, server_default=func.now())
     additional_metadata = Column(Text)
+    # Normalised text hash used to skip and compact duplicate chunks
+    content_hash = Column(String, nullable=True)
+    # Retrieval stats for lifecycle eviction, written in batches
+    retrieval_count = Column(Integer, default=0)
+    last_retrieved_at = Column(DateTime, nullable=True)
 
     # Relationships
     agent = relationship("Agent", backref="memories")
@@ -2628,6 +2691,12 @@ def setup_vector_column(target, connection, **kw):
                 """
             )
         )
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS memory_agent_hash_idx "
+                "ON memory (agent_id, content_hash)"
+            )
+        )
     except Exception as e:
         logging.error(f"Error setting up memory indices: {e}")
 
@@ -2672,37 +2741,40 @@ def calculate_vector_similarity(query_embedding, stored_embedding):
 
 # Update the memory search query for both databases:
 def get_similar_memories(
-    session, query_embedding, agent_id, conversation_id, limit, min_score
+    session,
+    query_embedding,
+    agent_id,
+    conversation_id,
+    limit,
+    min_score,
+    filters=None,
 ):
-    """Get similar memories using basic SQL and Python-based similarity calculation"""
+    """Get similar memories, scoring every candidate vector in one numpy pass"""
     try:
-        # Get all potentially relevant memories
-        memories = (
-            session.query(Memory)
-            .filter(
-                Memory.agent_id == agent_id,
-                or_(
-                    Memory.conversation_id == conversation_id,
-                    Memory.conversation_id == None,
-                ),
-            )
-            .all()
+        # Only the ids and vectors are needed to score; full rows are loaded
+        # for the winners alone
+        query = session.query(Memory.id, Memory.embedding).filter(
+            Memory.agent_id == agent_id,
+            or_(
+                Memory.conversation_id == conversation_id,
+                Memory.conversation_id == None,
+            ),
         )
-
-        # Calculate similarities
-        memory_scores = [
-            (mem, calculate_vector_similarity(query_embedding, mem.embedding))
-            for mem in memories
-        ]
-
-        # Filter by minimum score and sort by similarity
-        filtered_memories = [
-            (mem, score) for mem, score in memory_scores if score >= min_score
+        query = apply_memory_filters(query, Memory, filters)
+        ranked = rank_by_similarity(query_embedding, query.all(), limit, min_score)
+        if not ranked:
+            return []
+        memories = {
+            memory.id: memory
+            for memory in session.query(Memory)
+            .filter(Memory.id.in_([memory_id for memory_id, _ in ranked]))
+            .all()
+        }
+        return [
+            (memories[memory_id], score)
+            for memory_id, score in ranked
+            if memory_id in memories
         ]
-        filtered_memories.sort(key=lambda x: x[1], reverse=True)
-
-        # Return top N results
-        return filtered_memories[:limit]
 
     except Exception as e:
         logging.error(f"Error in memory search: {e}")
@@ -8561,6 +8633,52 @@ def check_schema_migrations_needed():
                         return True
                 except Exception:
                     return True
+
+                try:
+                    result = session.execute(text("PRAGMA table_info(memory)"))
+                    columns = {row[1] for row in result.fetchall()}
+                    if (
+                        not {
+                            "content_hash",
+                            "retrieval_count",
+                            "last_retrieved_at",
+                        }
+                        <= columns
+                    ):
+                        return True
+                except Exception:
+                    return True
+
+                try:
+                    result = session.execute(
+                        text('PRAGMA table_info("CompanyTokenUsage")')
+                    )
+                    columns = {row[1] for row in result.fetchall()}
+                    if "rolled_up" not in columns:
+                        return True
+                except Exception:
+                    return True
+
+                try:
+                    result = session.execute(text('PRAGMA table_info("Company")'))
+                    columns = {row[1] for row in result.fetchall()}
+                    if "billing_version" not in columns:
+                        return True
+                except Exception:
+                    return True
+
+                # Sentinel for the memory full-text index
+                try:
+                    result = session.execute(
+                        text(
+                            "SELECT 1 FROM sqlite_master "
+                            "WHERE type='table' AND name='memory_fts'"
+                        )
+                    )
+                    if not result.fetchone():
+                        return True
+                except Exception:
+                    return True
             else:
                 # PostgreSQL - check for latest migration indicators
                 result = session.execute(
@@ -8616,12 +8734,250 @@ def check_schema_migrations_needed():
                 if not result.fetchone():
                     return True
 
+                result = session.execute(
+                    text(
+                        "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_memory_text_fts'"
+                    )
+                )
+                if not result.fetchone():
+                    return True
+
+                result = session.execute(
+                    text(
+                        """
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'memory'
+                        AND column_name = 'content_hash'
+                        """
+                    )
+                )
+                if not result.fetchone():
+                    return True
+
+                result = session.execute(
+                    text(
+                        """
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'CompanyTokenUsage'
+                        AND column_name = 'rolled_up'
+                        """
+                    )
+                )
+                if not result.fetchone():
+                    return True
+
+                result = session.execute(
+                    text(
+                        """
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'Company'
+                        AND column_name = 'billing_version'
+                        """
+                    )
+                )
+                if not result.fetchone():
+                    return True
+
+                result = session.execute(
+                    text(
+                        """
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'memory'
+                        AND column_name = 'retrieval_count'
+                        """
+                    )
+                )
+                if not result.fetchone():
+                    return True
+
             return False
     except Exception as e:
         logging.warning(f"Could not check migration status, will run migrations: {e}")
         return True
 
 
+def migrate_memory_content_hash():
+    """
+    Add memory.content_hash and its (agent_id, content_hash) index so duplicate
+    chunks can be skipped on write. Existing rows are hashed lazily by the
+    memory compaction service.
+    """
+    if engine is None:
+        return
+
+    try:
+        with get_db_session() as session:
+            if DATABASE_TYPE == "sqlite":
+                result = session.execute(text("PRAGMA table_info(memory)"))
+                exists = "content_hash" in [row[1] for row in result.fetchall()]
+            else:
+                result = session.execute(
+                    text(
+                        """
+                        SELECT column_name FROM information_schema.columns
+                        WHERE table_name = 'memory' AND column_name = 'content_hash'
+                        """
+                    )
+                )
+                exists = result.fetchone() is not None
+            if not exists:
+                session.execute(
+                    text("ALTER TABLE memory ADD COLUMN content_hash VARCHAR")
+                )
+            session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS memory_agent_hash_idx "
+                    "ON memory (agent_id, content_hash)"
+                )
+            )
+            session.commit()
+    except Exception as e:
+        logging.error(f"Error migrating memory table: {e}")
+
+
+def migrate_memory_lifecycle_columns():
+    """
+    Add memory.retrieval_count and memory.last_retrieved_at, which the memory
+    lifecycle service uses to evict the least recently retrieved rows.
+    """
+    if engine is None:
+        return
+
+    columns = {
+        "retrieval_count": "INTEGER DEFAULT 0",
+        "last_retrieved_at": "TIMESTAMP" if DATABASE_TYPE != "sqlite" else "DATETIME",
+    }
+    try:
+        with get_db_session() as session:
+            if DATABASE_TYPE == "sqlite":
+                result = session.execute(text("PRAGMA table_info(memory)"))
+                existing = {row[1] for row in result.fetchall()}
+            else:
+                result = session.execute(
+                    text(
+                        """
+                        SELECT column_name FROM information_schema.columns
+                        WHERE table_name = 'memory'
+                        """
+                    )
+                )
+                existing = {row[0] for row in result.fetchall()}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    session.execute(
+                        text(f"ALTER TABLE memory ADD COLUMN {column} {column_type}")
+                    )
+            session.commit()
+    except Exception as e:
+        logging.error(f"Error migrating memory lifecycle columns: {e}")
+
+
+def migrate_company_token_usage_rollups():
+    """
+    Add CompanyTokenUsage.agent_id and .rolled_up for the usage rollups,
+    an index over the rows the backfill still has to roll up, and a
+    (company_id, timestamp) index for the recent usage listing. Existing rows
+    have rolled_up NULL and are rolled up by the BillingAnalytics backfill.
+    """
+    if engine is None:
+        return
+
+    columns = {
+        "agent_id": "VARCHAR",
+        "rolled_up": "BOOLEAN",
+    }
+    pending = (
+        "rolled_up IS NOT 1" if DATABASE_TYPE == "sqlite" else "rolled_up IS NOT TRUE"
+    )
+    try:
+        with get_db_session() as session:
+            if DATABASE_TYPE == "sqlite":
+                result = session.execute(text('PRAGMA table_info("CompanyTokenUsage")'))
+                existing = {row[1] for row in result.fetchall()}
+            else:
+                result = session.execute(
+                    text(
+                        """
+                        SELECT column_name FROM information_schema.columns
+                        WHERE table_name = 'CompanyTokenUsage'
+                        """
+                    )
+                )
+                existing = {row[0] for row in result.fetchall()}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    session.execute(
+                        text(
+                            f'ALTER TABLE "CompanyTokenUsage" ADD COLUMN {column} {column_type}'
+                        )
+                    )
+            session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_company_token_usage_pending "
+                    f'ON "CompanyTokenUsage" (timestamp, id) WHERE {pending}'
+                )
+            )
+            session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_company_token_usage_company_ts "
+                    'ON "CompanyTokenUsage" (company_id, timestamp)'
+                )
+            )
+            session.commit()
+    except Exception as e:
+        logging.error(f"Error migrating CompanyTokenUsage for usage rollups: {e}")
+
+
+def migrate_company_billing_version():
+    """
+    Add Company.billing_version, which versions the entitlements cached by
+    Entitlements. Existing companies start at 0.
+    """
+    if engine is None:
+        return
+
+    try:
+        with get_db_session() as session:
+            if DATABASE_TYPE == "sqlite":
+                result = session.execute(text('PRAGMA table_info("Company")'))
+                existing = {row[1] for row in result.fetchall()}
+            else:
+                result = session.execute(
+                    text(
+                        """
+                        SELECT column_name FROM information_schema.columns
+                        WHERE table_name = 'Company'
+                        """
+                    )
+                )
+                existing = {row[0] for row in result.fetchall()}
+            if "billing_version" not in existing:
+                session.execute(
+                    text(
+                        'ALTER TABLE "Company" ADD COLUMN billing_version INTEGER DEFAULT 0'
+                    )
+                )
+                session.commit()
+    except Exception as e:
+        logging.error(f"Error adding Company.billing_version: {e}")
+
+
+def migrate_memory_text_index():
+    """Full-text index over memory.text for hybrid (lexical + vector) recall.
+
+    SQLite gets an FTS5 table kept in sync by triggers and backfilled from the
+    existing rows; PostgreSQL gets a GIN index on to_tsvector('simple', text).
+    Idempotent.
+    """
+    if engine is None:
+        return
+    try:
+        with get_db_session() as session:
+            ensure_memory_text_index(session)
+    except Exception as e:
+        logging.warning(f"Could not create memory text index: {e}")
+
+
 def run_all_schema_migrations():
     """
     Run all schema and data migrations in dependency order.
@@ -8656,10 +9012,15 @@ def run_all_schema_migrations():
     migrate_conversation_participant_notification_mode()
     migrate_user_company_sort_order()
     migrate_bot_instance_id()
+    migrate_memory_content_hash()
+    migrate_memory_lifecycle_columns()
+    migrate_company_token_usage_rollups()
+    migrate_company_billing_version()
 
     # Phase 3: Performance indexes
     migrate_performance_indexes()
     migrate_search_indexes()
+    migrate_memory_text_index()
 
     # Phase 4: One-time data cleanup migrations
     migrate_cleanup_duplicate_wallet_settings()
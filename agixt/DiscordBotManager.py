@@ -73,6 +73,7 @@ except Exception as e:
 
 from DB import get_session, CompanyExtensionSetting, Company
 from Globals import getenv
+from BotRuntime import BOT_WORKER_INDEX, BOT_WORKERS, BotRuntime, CompanyInbox
 from MagicalAuth import impersonate_user
 from InternalClient import InternalClient
 from Models import ChatCompletions
@@ -89,6 +90,15 @@ def _get_discord_user_ids(company_id=None):
 
 logger = logging.getLogger(__name__)
 
+# Each sharded bot worker publishes its own bots under a suffixed key
+DISCORD_STATUS_KEY = "agixt:discord_bot_status"
+
+
+def _discord_status_key() -> str:
+    if BOT_WORKERS > 1:
+        return f"{DISCORD_STATUS_KEY}:{BOT_WORKER_INDEX}"
+    return DISCORD_STATUS_KEY
+
 
 @dataclass
 class BotStatus:
@@ -159,6 +169,8 @@ class CompanyDiscordBot:
         self._started_at: Optional[datetime] = None
         self._messages_processed: int = self._load_messages_processed()
         self._unsaved_message_count: int = 0  # Track unsaved increments for batching
+        # Messages are handled from a bounded per-company queue
+        self.inbox = CompanyInbox(company_id)
 
         # Register event handlers
         self._setup_events()
@@ -276,7 +288,7 @@ class CompanyDiscordBot:
             # Ignore messages from the bot itself
             if message.author == self.bot.user:
                 return
-            await self._handle_message(message)
+            self.inbox.submit(lambda: self._handle_message(message))
             await self.bot.process_commands(message)
 
     def _refresh_discord_user_cache(self):
@@ -1892,6 +1904,7 @@ HOW TO READ:
         # Save any unsaved message count before stopping
         if self._unsaved_message_count > 0:
             self._save_messages_processed()
+        await self.inbox.close()
         if not self.bot.is_closed():
             await self.bot.close()
         self._is_ready = False
@@ -1940,6 +1953,8 @@ class DiscordBotManager:
         self._monitor_task: Optional[asyncio.Task] = None
         # Crash tracking: {company_id: {"count": int, "last_crash": float, "backoff_until": float}}
         self._crash_tracker: Dict[str, Dict] = {}
+        # Set when bots are owned through the sharded BotRuntime
+        self.runtime: Optional[BotRuntime] = None
 
     def _is_in_backoff(self, company_id: str) -> bool:
         """Check if a bot is in backoff period after crashes."""
@@ -1991,9 +2006,11 @@ class DiscordBotManager:
 
         return None
 
-    def get_company_bot_config(self) -> Dict[str, Dict[str, str]]:
+    def get_company_bot_config(
+        self, company_id: str = None
+    ) -> Dict[str, Dict[str, str]]:
         """
-        Get Discord bot configuration for all companies from the database.
+        Get Discord bot configuration for all companies (or one) from the database.
         Returns: {company_id: {"token": "...", "enabled": "true/false", "name": "...",
                                "agent_id": "...", "permission_mode": "...", "owner_id": "...", "allowlist": "..."}}
         """
@@ -2001,7 +2018,7 @@ class DiscordBotManager:
 
         with get_session() as db:
             # Get all companies with Discord bot settings
-            settings = (
+            query = (
                 db.query(CompanyExtensionSetting)
                 .filter(CompanyExtensionSetting.extension_name == "discord")
                 .filter(
@@ -2016,8 +2033,10 @@ class DiscordBotManager:
                         ]
                     )
                 )
-                .all()
             )
+            if company_id:
+                query = query.filter(CompanyExtensionSetting.company_id == company_id)
+            settings = query.all()
 
             # Group by company
             for setting in settings:
@@ -2061,6 +2080,31 @@ class DiscordBotManager:
 
         return configs
 
+    def is_bot_runnable(self, config: Dict[str, str]) -> bool:
+        """Whether a company config is enabled and has a token."""
+        return bool(
+            (config.get("enabled") or "").lower() == "true" and config.get("token")
+        )
+
+    def get_server_bot_config(self) -> Optional[Dict[str, str]]:
+        """Config of the server-level bot shared by all companies, if any."""
+        token = self.get_server_bot_token()
+        if not token:
+            return None
+        return {"name": "AGiXT Server Bot", "token": token}
+
+    async def start_bot_from_config(self, bot_id: str, config: Dict[str, str]) -> bool:
+        """Start a bot from a get_company_bot_config / get_server_bot_config entry."""
+        return await self.start_bot_for_company(
+            company_id=bot_id,
+            company_name=config["name"],
+            token=config["token"],
+            agent_id=config.get("agent_id"),
+            permission_mode=config.get("permission_mode") or "recognized_users",
+            owner_id=config.get("owner_id"),
+            allowlist=config.get("allowlist"),
+        )
+
     async def start_bot_for_company(
         self,
         company_id: str,
@@ -2196,8 +2240,7 @@ class DiscordBotManager:
 
         # Check if any company has its own bot configured and enabled
         company_bots_configured = any(
-            config.get("enabled", "").lower() == "true" and config.get("token")
-            for config in company_configs.values()
+            self.is_bot_runnable(config) for config in company_configs.values()
         )
 
         if company_bots_configured:
@@ -2222,25 +2265,11 @@ class DiscordBotManager:
 
             # Start company bots that should be running
             for company_id, config in company_configs.items():
-                if (
-                    config.get("enabled", "").lower() == "true"
-                    and config.get("token")
-                    and company_id not in self.bots
-                ):
+                if self.is_bot_runnable(config) and company_id not in self.bots:
                     # Check backoff before restarting
                     if self._is_in_backoff(company_id):
                         continue
-                    await self.start_bot_for_company(
-                        company_id=company_id,
-                        company_name=config["name"],
-                        token=config["token"],
-                        agent_id=config.get("agent_id"),
-                        permission_mode=config.get(
-                            "permission_mode", "recognized_users"
-                        ),
-                        owner_id=config.get("owner_id"),
-                        allowlist=config.get("allowlist"),
-                    )
+                    await self.start_bot_from_config(company_id, config)
 
         elif server_token:
             # No company bots configured - use server-level bot
@@ -2380,11 +2409,10 @@ class DiscordBotManager:
                     ),
                     "is_running": bot.is_ready,
                     "guild_count": bot.guild_count,
+                    "inbox": bot.inbox.get_stats(),
                 }
 
-            r.set(
-                "agixt:discord_bot_status", json.dumps(statuses), ex=30
-            )  # 30 second TTL
+            r.set(_discord_status_key(), json.dumps(statuses), ex=30)  # 30 second TTL
             r.set("agixt:discord_bot_manager_running", "1", ex=30)
 
         except Exception as e:
@@ -2419,12 +2447,18 @@ def get_discord_bot_status_from_redis(company_id: str) -> Optional[BotStatus]:
         if not r.get("agixt:discord_bot_manager_running"):
             return None
 
-        status_data = r.get("agixt:discord_bot_status")
-        if not status_data:
+        # Merge the statuses published by every bot worker
+        statuses = {}
+        keys = [DISCORD_STATUS_KEY] + sorted(
+            r.scan_iter(match=f"{DISCORD_STATUS_KEY}:*", count=100)
+        )
+        for key in keys:
+            status_data = r.get(key)
+            if status_data:
+                statuses.update(json.loads(status_data))
+        if not statuses:
             return None
 
-        statuses = json.loads(status_data)
-
         # Check for company-specific bot
         if company_id in statuses:
             s = statuses[company_id]
@@ -2477,7 +2511,10 @@ async def start_discord_bot_manager():
     if manager is None:
         manager = DiscordBotManager()
         _registry_set(manager)
-    await manager.start()
+    # Bots hashed to this worker, started and restarted on config events
+    if manager.runtime is None:
+        manager.runtime = BotRuntime("discord", manager)
+    await manager.runtime.start()
 
     # Start the status publisher background task
     asyncio.create_task(manager._status_publisher_loop())
@@ -2489,6 +2526,8 @@ async def stop_discord_bot_manager():
     """Stop the global Discord bot manager."""
     manager = get_discord_bot_manager()
     if manager:
+        if manager.runtime is not None:
+            await manager.runtime.stop()
         await manager.stop()
         _registry_set(None)
 
@@ -2504,7 +2543,8 @@ async def stop_discord_bot_manager():
                     r = redis.from_url(redis_uri)
                 else:
                     r = redis.Redis(host=redis_host, port=6379, db=0)
-                r.delete("agixt:discord_bot_status")
-                r.delete("agixt:discord_bot_manager_running")
+                r.delete(_discord_status_key())
+                if BOT_WORKERS <= 1:
+                    r.delete("agixt:discord_bot_manager_running")
         except Exception as e:
             logger.warning(f"Failed to clear Discord bot status from Redis: {e}")
@@ -0,0 +1,472 @@
+"""
+DocumentIngestion - Text extraction for uploaded documents, off the request path
+
+learn_from_file used to parse every format inline on the event loop. Here:
+
+- extractors are registered per file extension (`register_extractor`) and run
+  in a worker thread through `extract_document`;
+- PDFs are split into page ranges that a process pool extracts in parallel,
+  then reassembled in page order;
+- zip archives are extracted member by member with streamed copies and hard
+  limits on member count, sizes and compression ratio instead of `extractall`;
+- `IngestionJobManager` runs a whole learn-from-file in the background with
+  its progress in SharedCache, so upload endpoints can return a job at once.
+
+Format libraries are imported inside the extractors, which keeps this module
+cheap to import in the process pool's workers.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# (done, total) units of work, e.g. pages read out of the page count
+ProgressCallback = Callable[[int, int], None]
+
+# Worker processes for page-level PDF extraction; 1 extracts in-process
+PDF_WORKERS = int(
+    os.getenv("DOCUMENT_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+# Pages handed to a worker per task, and the size below which the pool's
+# start-up and per-task re-open of the file cost more than they save
+PDF_PAGES_PER_TASK = 16
+PDF_PARALLEL_MIN_PAGES = 32
+
+ZIP_COPY_CHUNK = 1024 * 1024
+
+# Finished jobs stay pollable for a day
+INGESTION_JOB_TTL = 86400
+
+# Minimum seconds between progress writes for a running job
+PROGRESS_WRITE_INTERVAL = 1.0
+
+
+@dataclass
+class ExtractedDocument:
+    text: str
+    # How the document is described in memories, e.g. "Content from PDF ..."
+    label: str
+    units: int = 0
+    unit_name: str = "page"
+
+
+Extractor = Callable[[str, Optional[ProgressCallback]], ExtractedDocument]
+
+EXTRACTORS: Dict[str, Extractor] = {}
+
+
+def register_extractor(*extensions: str):
+    """Register a function(path, progress) -> ExtractedDocument for extensions"""
+
+    def decorator(function: Extractor) -> Extractor:
+        for extension in extensions:
+            EXTRACTORS[extension.lower().lstrip(".")] = function
+        return function
+
+    return decorator
+
+
+def get_extractor(file_name: str) -> Optional[Extractor]:
+    extension = os.path.splitext(file_name)[1].lower().lstrip(".")
+    return EXTRACTORS.get(extension)
+
+
+async def extract_document(
+    file_path: str, progress: Optional[ProgressCallback] = None
+) -> ExtractedDocument:
+    """
+    Extract the text of a document with its registered extractor.
+
+    The extractor runs in a worker thread, so `progress` is called from that
+    thread. Raises ValueError for extensions without an extractor.
+    """
+    extractor = get_extractor(file_path)
+    if extractor is None:
+        raise ValueError(f"No extractor for {os.path.basename(file_path)}")
+    return await asyncio.to_thread(extractor, file_path, progress)
+
+
+def throttle_progress(callback: ProgressCallback, steps: int = 4) -> ProgressCallback:
+    """Only pass on progress when it crosses the next of `steps` equal marks"""
+    last_step = -1
+
+    def report(done: int, total: int):
+        nonlocal last_step
+        step = steps if total <= 0 else min(steps, done * steps // total)
+        if step > last_step:
+            last_step = step
+            callback(done, total)
+
+    return report
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            # Forking a threaded server can deadlock the child, so spawn
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) (0-based); runs in a pool worker"""
+    import pdfplumber
+
+    texts = []
+    with pdfplumber.open(file_path, pages=list(range(start + 1, stop + 1))) as pdf:
+        for page in pdf.pages:
+            texts.append(page.extract_text() or "")
+            # Drop the parsed layout so long ranges do not accumulate it
+            page.close()
+    return texts
+
+
+def _pdf_page_count(file_path: str) -> int:
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+@register_extractor("pdf")
+def extract_pdf(
+    file_path: str, progress: Optional[ProgressCallback] = None
+) -> ExtractedDocument:
+    total = _pdf_page_count(file_path)
+    pages: List[Optional[str]] = [None] * total
+    done = 0
+    if PDF_WORKERS > 1 and total >= PDF_PARALLEL_MIN_PAGES:
+        ranges = [
+            (start, min(start + PDF_PAGES_PER_TASK, total))
+            for start in range(0, total, PDF_PAGES_PER_TASK)
+        ]
+        try:
+            pool = get_process_pool()
+            futures = {
+                pool.submit(_extract_pdf_pages, file_path, start, stop): (start, stop)
+                for start, stop in ranges
+            }
+            for future in as_completed(futures):
+                start, stop = futures[future]
+                pages[start:stop] = future.result()
+                done += stop - start
+                if progress:
+                    progress(done, total)
+        except BrokenProcessPool as e:
+            logger.warning(f"PDF worker pool failed, extracting in-process: {e}")
+            shutdown_process_pool()
+            done = sum(1 for page in pages if page is not None)
+    for start in range(0, total, PDF_PAGES_PER_TASK):
+        stop = min(start + PDF_PAGES_PER_TASK, total)
+        if all(page is not None for page in pages[start:stop]):
+            continue
+        pages[start:stop] = _extract_pdf_pages(file_path, start, stop)
+        done += stop - start
+        if progress:
+            progress(done, total)
+    return ExtractedDocument(text="\n".join(pages), label="PDF", units=total)
+
+
+@register_extractor("doc", "docx")
+def extract_docx(
+    file_path: str, progress: Optional[ProgressCallback] = None
+) -> ExtractedDocument:
+    import docx2txt
+
+    text = docx2txt.process(file_path)
+    if progress:
+        progress(1, 1)
+    return ExtractedDocument(text=text, label="the document", units=1)
+
+
+@register_extractor("ppt", "pptx")
+def extract_pptx(
+    file_path: str, progress: Optional[ProgressCallback] = None
+) -> ExtractedDocument:
+    from pptx import Presentation
+
+    slides = list(Presentation(file_path).slides)
+    content = []
+    for slide_number, slide in enumerate(slides, 1):
+        slide_text = [
+            shape.text.strip()
+            for shape in slide.shapes
+            if hasattr(shape, "text") and shape.text.strip()
+        ]
+        if slide_text:
+            content.append(f"Slide {slide_number}:\n" + "\n".join(slide_text))
+        if progress:
+            progress(slide_number, len(slides))
+    return ExtractedDocument(
+        text="\n\n".join(content),
+        label="PowerPoint",
+        units=len(slides),
+        unit_name="slide",
+    )
+
+
+@dataclass
+class ZipLimits:
+    """Bounds on what an uploaded archive may expand to"""
+
+    max_members: int = int(os.getenv("ZIP_MAX_MEMBERS", "20000"))
+    max_total_bytes: int = int(os.getenv("ZIP_MAX_TOTAL_MB", "2048")) * 1024 * 1024
+    max_member_bytes: int = int(os.getenv("ZIP_MAX_MEMBER_MB", "512")) * 1024 * 1024
+    # Uncompressed / compressed size above which a large member is a zip bomb
+    max_ratio: float = 200.0
+
+
+@dataclass
+class ZipExtraction:
+    files: int = 0
+    directories: int = 0
+    bytes_written: int = 0
+    skipped: List[str] = field(default_factory=list)
+
+
+# Members smaller than this are not held to the compression ratio limit
+_RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+
+def _member_target(destination: str, name: str) -> Optional[str]:
+    """Absolute path for a member, or None if it would land outside"""
+    if not name or name.startswith(("/", "\\")) or ":" in name.split("/")[0]:
+        return None
+    parts = name.replace("\\", "/").split("/")
+    if ".." in parts:
+        return None
+    target = os.path.abspath(os.path.join(destination, *parts))
+    if target != destination and not target.startswith(destination + os.sep):
+        return None
+    return target
+
+
+def extract_zip(
+    file_path: str,
+    destination: str,
+    limits: Optional[ZipLimits] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> ZipExtraction:
+    """
+    Extract an archive one member at a time, streaming each member to disk.
+
+    Unsafe members (absolute paths, `..`, symlinks) are skipped. The central
+    directory is checked against `limits` before anything is written, and the
+    bytes actually decompressed are counted as well, so a member that lies
+    about its size cannot exceed them either. Raises ValueError when a limit
+    is hit; a destination created by this call is removed again in that case.
+    """
+    limits = limits or ZipLimits()
+    destination = os.path.abspath(destination)
+    created = not os.path.exists(destination)
+    result = ZipExtraction()
+    try:
+        with zipfile.ZipFile(file_path, "r") as archive:
+            members = archive.infolist()
+            if len(members) > limits.max_members:
+                raise ValueError(
+                    f"Archive has {len(members)} entries, the limit is "
+                    f"{limits.max_members}"
+                )
+            declared = sum(member.file_size for member in members)
+            if declared > limits.max_total_bytes:
+                raise ValueError(
+                    f"Archive expands to {declared} bytes, the limit is "
+                    f"{limits.max_total_bytes}"
+                )
+            os.makedirs(destination, exist_ok=True)
+            for index, member in enumerate(members, 1):
+                target = _member_target(destination, member.filename)
+                mode = member.external_attr >> 16
+                if target is None or stat.S_ISLNK(mode):
+                    result.skipped.append(member.filename)
+                elif member.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    result.directories += 1
+                else:
+                    if member.file_size > limits.max_member_bytes:
+                        raise ValueError(
+                            f"{member.filename} is {member.file_size} bytes, the "
+                            f"limit is {limits.max_member_bytes}"
+                        )
+                    if (
+                        member.file_size > _RATIO_CHECK_MIN_BYTES
+                        and member.file_size
+                        > limits.max_ratio * max(member.compress_size, 1)
+                    ):
+                        raise ValueError(
+                            f"{member.filename} has a suspicious compression ratio"
+                        )
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    result.bytes_written += _copy_member(
+                        archive, member, target, limits, result.bytes_written
+                    )
+                    result.files += 1
+                if progress:
+                    progress(index, len(members))
+    except (ValueError, zipfile.BadZipFile):
+        if created:
+            shutil.rmtree(destination, ignore_errors=True)
+        raise
+    return result
+
+
+def _copy_member(archive, member, target, limits: ZipLimits, written_so_far: int):
+    written = 0
+    allowed = min(member.file_size, limits.max_member_bytes)
+    with archive.open(member) as source, open(target, "wb") as sink:
+        while True:
+            chunk = source.read(ZIP_COPY_CHUNK)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > allowed or written_so_far + written > limits.max_total_bytes:
+                raise ValueError(f"{member.filename} expands beyond its stated size")
+            sink.write(chunk)
+    return written
+
+
+@dataclass
+class IngestionJob:
+    id: str
+    user_id: str
+    file_name: str
+    status: str = "queued"
+    stage: str = "queued"
+    done: int = 0
+    total: int = 0
+    message: Optional[str] = None
+    error: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+# (stage, done, total), e.g. ("extracting", 120, 500)
+StageProgressCallback = Callable[[str, int, int], None]
+
+
+class IngestionJobManager:
+    """
+    Background document ingestion with job state in SharedCache.
+
+    The work runs in the worker that accepted the upload; any worker can
+    report its status. Progress may be reported from extraction threads.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or shared_cache
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"ingestion_job:{job_id}"
+
+    def _save(self, job: IngestionJob):
+        self.cache.set(self._key(job.id), asdict(job), ttl=INGESTION_JOB_TTL)
+
+    def submit(
+        self,
+        user_id: str,
+        file_name: str,
+        run: Callable[[StageProgressCallback], Awaitable[str]],
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> dict:
+        """
+        Start `run(progress)` in the background and return its job record.
+
+        `run` returns the message shown to the user when it finishes.
+        """
+        job = IngestionJob(
+            id=str(uuid.uuid4()),
+            user_id=str(user_id),
+            file_name=file_name,
+            metadata=metadata or {},
+        )
+        self._save(job)
+        task = asyncio.create_task(self._run(job, run))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return asdict(job)
+
+    async def _run(self, job: IngestionJob, run):
+        job.status = "running"
+        job.started_at = datetime.now().isoformat()
+        self._save(job)
+        last_write = time.monotonic()
+
+        def progress(stage: str, done: int, total: int):
+            nonlocal last_write
+            changed_stage = stage != job.stage
+            job.stage, job.done, job.total = stage, done, total
+            if (
+                changed_stage
+                or time.monotonic() - last_write >= PROGRESS_WRITE_INTERVAL
+            ):
+                last_write = time.monotonic()
+                self._save(job)
+
+        try:
+            job.message = await run(progress)
+            job.status = "completed"
+            job.stage = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} for {job.file_name} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now().isoformat()
+            self._save(job)
+
+    def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        """Fetch a job record owned by the user, or None"""
+        record = self.cache.get(self._key(job_id))
+        if not record or record.get("user_id") != str(user_id):
+            return None
+        return record
+
+    async def wait(self, job_id: str) -> None:
+        """Wait for a job started by this worker to finish"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+
+ingestion_jobs = IngestionJobManager()
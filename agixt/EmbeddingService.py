@@ -0,0 +1,354 @@
+"""
+EmbeddingService - Local ONNX embeddings with dynamic micro-batching
+
+`OnnxEmbedder` is the sentence embedding model behind `Memories.embed`: the
+ONNX model and tokenizer in ./onnx, mean pooled and L2 normalized.
+
+ONNX inference is CPU bound, so calling it on the event loop stalls every
+other request for the whole forward pass. `EmbeddingBatcher` runs it on a
+dedicated thread pool instead (onnxruntime releases the GIL while running),
+and coalesces requests that arrive within a short window into one model
+call: a burst of single-sentence requests costs one batch rather than one
+forward pass each.
+
+    from EmbeddingService import embedding_batcher
+    vectors = await embedding_batcher.embed(["first text", "second text"])
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Suppress onnxruntime C++ GPU device discovery warnings in containers without GPUs
+os.environ.setdefault("ORT_LOG_LEVEL", "3")  # ERROR level only
+
+logger = logging.getLogger(__name__)
+
+Embedder = Callable[[List[str]], List[Sequence[float]]]
+
+# Texts per ONNX forward pass
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# How long the first request of a batch waits for others to join it
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+
+# Inference threads. ONNX Runtime already parallelizes each forward pass
+# across cores, so more than one mostly adds contention.
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+
+# Load model_quantized.onnx (see quantize_model) instead of model.onnx
+EMBEDDING_QUANTIZED = os.getenv("EMBEDDING_QUANTIZED", "false").lower() == "true"
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+ENCODING_FORMATS = ("float", "base64")
+
+
+def embedding_model_file(model_dir: str) -> str:
+    """The model file in use: the int8 variant when enabled and present"""
+    if EMBEDDING_QUANTIZED and os.path.exists(
+        os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    ):
+        return QUANTIZED_MODEL_FILE
+    return MODEL_FILE
+
+
+def default_intra_op_threads() -> int:
+    """
+    Cores per forward pass. Every uvicorn worker loads its own session, so
+    giving each one all cores oversubscribes the CPU under load.
+    """
+    configured = os.getenv("EMBEDDING_INTRA_OP_THREADS")
+    if configured:
+        return max(1, int(configured))
+    workers = max(1, int(os.getenv("UVICORN_WORKERS", "1"))) * EMBEDDING_WORKERS
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def quantize_model(model_dir: str) -> str:
+    """Write a dynamically int8-quantized copy of model.onnx; returns its path"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    quantize_dynamic(
+        os.path.join(model_dir, MODEL_FILE), output, weight_type=QuantType.QInt8
+    )
+    return output
+
+
+class OnnxEmbedder:
+    """
+    Sentence embeddings from an exported ONNX encoder, loaded on first use.
+
+    Inputs are sorted by token length and each batch is padded only to its
+    longest member, so a batch of short sentences does not pay for 256
+    positions. Padding is masked out of the mean pooling, so the vectors match
+    fixed-length padding (`bucket_by_length=False`) to float precision.
+    """
+
+    def __init__(
+        self,
+        model_dir: Optional[str] = None,
+        max_length: int = 256,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        bucket_by_length: bool = True,
+        intra_op_threads: Optional[int] = None,
+    ):
+        self.model_dir = model_dir
+        self.max_length = max_length
+        self.batch_size = max(1, batch_size)
+        self.bucket_by_length = bucket_by_length
+        self.intra_op_threads = intra_op_threads or default_intra_op_threads()
+        self.model_file: Optional[str] = None
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is not None:
+                return
+            from onnxruntime import (
+                ExecutionMode,
+                GraphOptimizationLevel,
+                InferenceSession,
+                SessionOptions,
+            )
+            from tokenizers import Tokenizer
+
+            model_dir = self.model_dir or os.path.join(os.getcwd(), "onnx")
+            tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_length)
+            tokenizer.no_padding()
+            options = SessionOptions()
+            options.intra_op_num_threads = self.intra_op_threads
+            # The encoder is one chain of ops; parallel branches buy nothing
+            options.inter_op_num_threads = 1
+            options.execution_mode = ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.model_file = embedding_model_file(model_dir)
+            if EMBEDDING_QUANTIZED and self.model_file != QUANTIZED_MODEL_FILE:
+                logger.warning(
+                    f"EMBEDDING_QUANTIZED is set but {QUANTIZED_MODEL_FILE} is "
+                    f"missing from {model_dir}; using {MODEL_FILE}"
+                )
+            self._tokenizer = tokenizer
+            self._model = InferenceSession(
+                os.path.join(model_dir, self.model_file),
+                sess_options=options,
+                providers=["CPUExecutionProvider"],
+            )
+            logger.info(
+                f"Loaded embedding model {self.model_file} with "
+                f"{self.intra_op_threads} intra-op threads"
+            )
+
+    def _embed_batch(self, input_ids: np.ndarray, attention_mask: np.ndarray):
+        onnx_input = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        }
+        last_hidden_state = self._model.run(None, onnx_input)[0]
+        input_mask_expanded = np.broadcast_to(
+            np.expand_dims(attention_mask, -1), last_hidden_state.shape
+        )
+        embeddings = np.sum(last_hidden_state * input_mask_expanded, 1) / np.clip(
+            input_mask_expanded.sum(1), a_min=1e-9, a_max=None
+        )
+        norm = np.linalg.norm(embeddings, axis=1)
+        norm[norm == 0] = 1e-12
+        return (embeddings / norm[:, np.newaxis]).astype(np.float32)
+
+    def _embed(self, input: List[str], bucket_by_length: bool) -> np.ndarray:
+        if self._model is None:
+            self._load()
+        encoded = [encoding.ids for encoding in self._tokenizer.encode_batch(input)]
+        order = list(range(len(input)))
+        if bucket_by_length:
+            order.sort(key=lambda index: len(encoded[index]))
+        vectors = [None] * len(input)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            length = self.max_length
+            if bucket_by_length:
+                length = max(len(encoded[index]) for index in batch)
+            input_ids = np.zeros((len(batch), length), dtype=np.int64)
+            attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+            for row, index in enumerate(batch):
+                ids = encoded[index]
+                input_ids[row, : len(ids)] = ids
+                attention_mask[row, : len(ids)] = 1
+            for index, vector in zip(
+                batch, self._embed_batch(input_ids, attention_mask)
+            ):
+                vectors[index] = vector
+        return np.stack(vectors)
+
+    def __call__(self, input: List[str]) -> List[Sequence[float]]:
+        if not input:
+            return []
+        return self._embed(list(input), self.bucket_by_length).tolist()
+
+    def warmup(self) -> float:
+        """Load the model and run a short and a full-length batch; returns seconds"""
+        start = time.perf_counter()
+        try:
+            self._embed(["warmup", "warmup " * self.max_length], True)
+        except Exception as e:
+            logger.warning(f"Embedding model warmup failed: {e}")
+        return time.perf_counter() - start
+
+    def benchmark(self, texts: Optional[List[str]] = None, rounds: int = 3) -> dict:
+        """
+        Time length-bucketed against fixed-length batches on `texts` (default:
+        a mix of short and long synthetic sentences) on this machine.
+        """
+        if not texts:
+            texts = [
+                " ".join(f"word{i}" for i in range(1 + (n * 37) % 120))
+                for n in range(256)
+            ]
+        self.warmup()
+        timings = {}
+        for label, bucket in (("bucketed", True), ("padded", False)):
+            best = None
+            for _ in range(max(1, rounds)):
+                start = time.perf_counter()
+                self._embed(texts, bucket)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best
+        return {
+            "texts": len(texts),
+            "model_file": self.model_file,
+            "intra_op_threads": self.intra_op_threads,
+            "bucketed_texts_per_second": round(len(texts) / timings["bucketed"], 1),
+            "padded_texts_per_second": round(len(texts) / timings["padded"], 1),
+            "speedup": round(timings["padded"] / timings["bucketed"], 2),
+        }
+
+
+def format_embedding(
+    vector: Sequence[float],
+    encoding_format: str = "float",
+    dimensions: Optional[int] = None,
+) -> Union[List[float], str]:
+    """
+    Shape a vector for the OpenAI embeddings API. `dimensions` keeps the
+    leading components and re-normalizes them; base64 is little-endian float32.
+    """
+    values = np.asarray(vector, dtype=np.float32)
+    if dimensions and dimensions < len(values):
+        values = values[:dimensions]
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values = values / norm
+    if encoding_format == "base64":
+        return base64.b64encode(values.astype("<f4").tobytes()).decode("ascii")
+    return values.tolist()
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent embedding requests into batched off-loop inference"""
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        max_batch_size: int = EMBEDDING_BATCH_SIZE,
+        window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        workers: int = EMBEDDING_WORKERS,
+    ):
+        self.embedder = embedder or local_embedder
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000
+        self.workers = max(1, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_texts = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "model_calls": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="embedding"
+            )
+        return self._executor
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, sharing a model call with concurrent requests"""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(texts), future))
+        self._pending_texts += len(texts)
+        self.stats["requests"] += 1
+        self.stats["texts"] += len(texts)
+        if self._pending_texts >= self.max_batch_size or not self.window:
+            self._flush(loop)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush, loop)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        requests, self._pending = self._pending, []
+        self._pending_texts = 0
+        if not requests:
+            return
+        task = loop.create_task(self._run_batch(requests))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _embed_all(self, texts: List[str]) -> List[Sequence[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.max_batch_size):
+            vectors.extend(self.embedder(texts[i : i + self.max_batch_size]))
+            self.stats["model_calls"] += 1
+        return vectors
+
+    async def _run_batch(self, requests: List[Tuple[List[str], asyncio.Future]]):
+        # Identical texts across requests are embedded once
+        positions = {}
+        for texts, _ in requests:
+            for text in texts:
+                positions.setdefault(text, len(positions))
+        self.stats["batches"] += 1
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), self._embed_all, list(positions)
+            )
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(positions)} texts failed: {e}")
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for texts, future in requests:
+            if not future.done():
+                future.set_result([list(vectors[positions[text]]) for text in texts])
+
+    def shutdown(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+local_embedder = OnnxEmbedder()
+embedding_batcher = EmbeddingBatcher()
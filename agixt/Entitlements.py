@@ -0,0 +1,917 @@
+"""
+Entitlements - Cached billing entitlements for hot-path balance and limit checks
+
+Every inference used to pay for billing in database round trips.
+`check_billing_balance` read the token price (two ServerConfig queries), the
+user's companies, walked each company up to its root parent and queried the
+companies again. `increase_token_counts` walked the parents again and worked
+out the plan period and tier. `check_user_limit`, `check_device_limit` and
+`check_storage_limit` each repeated the walk.
+
+The engine keeps what those checks need per company in one cache entry:
+
+- plan limits (tier limits plus addons)
+- token balance, trial credits and subscription state
+- the current period window and the tokens used in it
+- device and storage usage, and for tiered roots, the user count of the
+  billing org
+
+Entries live in SharedCache and, for a couple of seconds, in each worker, so
+hot-path checks are dictionary lookups. A user's companies and each
+company's root parent are cached the same way.
+
+Each entry carries `Company.billing_version`. Every change to a billing
+column bumps it: ORM writes do so through a `before_flush` hook, the atomic
+charge in its UPDATE. After commit, changed companies are dropped from the
+cache. A charge instead stores the new balances it read back, but only when
+its version is newer than the cached one. A periodic reconcile compares the
+versions of cached entries with the database and drops stale ones, so
+writes that bypass the ORM are picked up too.
+
+Charging is a single conditional UPDATE ... RETURNING, so concurrent requests
+can neither lose a decrement nor overdraw a balance. Negative answers are
+confirmed against the database before a request is refused.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from dateutil.relativedelta import relativedelta
+from fastapi import HTTPException
+from sqlalchemy import and_, case, event, func, inspect, not_, or_, update
+from sqlalchemy.orm import Session
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+PRICING_PER_TOKEN = "per_token"
+PRICING_TIERED = "tiered_plan"
+PRICING_PER_BED = "per_bed"
+SEAT_PRICING_MODELS = ("per_user", "per_capacity", "per_location")
+
+# How long an entitlement is shared between workers before it is reloaded
+ENTITLEMENT_CACHE_TTL = int(os.getenv("ENTITLEMENT_CACHE_TTL", "300"))
+# How long each worker trusts its own copy of an entry
+ENTITLEMENT_LOCAL_TTL = float(os.getenv("ENTITLEMENT_LOCAL_TTL", "2"))
+# How long a user's companies and a company's root parent are cached
+ENTITLEMENT_MEMBERSHIP_TTL = int(os.getenv("ENTITLEMENT_MEMBERSHIP_TTL", "60"))
+# How long the token price and pricing model are cached
+ENTITLEMENT_SETTINGS_TTL = int(os.getenv("ENTITLEMENT_SETTINGS_TTL", "15"))
+# Seconds between reconciles of cached entries against the database
+ENTITLEMENT_RECONCILE_INTERVAL = int(os.getenv("ENTITLEMENT_RECONCILE_INTERVAL", "60"))
+
+GIB = 1024 * 1024 * 1024
+
+# Company columns an entitlement is built from
+BILLING_FIELDS = (
+    "company_id",
+    "plan_id",
+    "user_limit",
+    "token_balance",
+    "token_balance_usd",
+    "auto_topup_enabled",
+    "stripe_subscription_id",
+    "device_count",
+    "storage_used_bytes",
+    "tokens_used_this_period",
+    "current_period_start",
+    "addon_users",
+    "addon_devices",
+    "addon_tokens",
+    "addon_storage_bytes",
+)
+
+_PENDING_KEY = "entitlements"
+
+
+def _pending(session) -> dict:
+    """Cache updates waiting for `session` to commit"""
+    return session.info.setdefault(
+        _PENDING_KEY, {"companies": set(), "users": set(), "store": {}}
+    )
+
+
+def utcnow() -> datetime:
+    """Naive UTC, the way billing timestamps are stored"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def period_end(period_start: datetime) -> datetime:
+    """Billing periods run a calendar month from their start"""
+    return period_start + relativedelta(months=1)
+
+
+def plan_tier(pricing_config: Optional[dict], plan_id: Optional[str]) -> dict:
+    """The tier of `plan_id` in the pricing config, {} when unknown"""
+    if not pricing_config or not plan_id:
+        return {}
+    for tier in pricing_config.get("tiers", []):
+        if tier.get("id") == plan_id:
+            return tier
+    return {}
+
+
+def pricing_model_of(pricing_config: Optional[dict]) -> str:
+    if not pricing_config:
+        return PRICING_PER_TOKEN
+    return pricing_config.get("pricing_model") or PRICING_PER_TOKEN
+
+
+@dataclass
+class Entitlement:
+    """What one company may use, as of `version`"""
+
+    company_id: str
+    version: int = 0
+    parent_id: Optional[str] = None
+    plan_id: Optional[str] = None
+    token_balance: int = 0
+    token_balance_usd: float = 0.0
+    has_subscription: bool = False
+    # Limits of the plan tier, before addons
+    plan_tokens: int = 0
+    plan_users: int = 0
+    plan_devices: int = 0
+    plan_storage_bytes: int = 0
+    addon_tokens: int = 0
+    addon_users: int = 0
+    addon_devices: int = 0
+    addon_storage_bytes: int = 0
+    # Company.user_limit, used by the legacy seat models
+    seat_limit: int = 0
+    tokens_used_this_period: int = 0
+    period_start: Optional[datetime] = None
+    device_count: int = 0
+    storage_used_bytes: int = 0
+    # Members across the billing org; only loaded for tiered plan roots
+    user_count: Optional[int] = None
+    org_company_ids: List[str] = field(default_factory=list)
+
+    @property
+    def token_limit(self) -> int:
+        return self.plan_tokens + self.addon_tokens
+
+    @property
+    def user_limit(self) -> int:
+        return self.plan_users + self.addon_users
+
+    @property
+    def device_limit(self) -> int:
+        return self.plan_devices + self.addon_devices
+
+    @property
+    def storage_limit_bytes(self) -> int:
+        return self.plan_storage_bytes + self.addon_storage_bytes
+
+    def period_elapsed(self, now: Optional[datetime] = None) -> bool:
+        if self.period_start is None:
+            return False
+        return (now or utcnow()) >= period_end(self.period_start)
+
+    def tokens_used(self, now: Optional[datetime] = None) -> int:
+        """Tokens used this period; a period that has ended counts as reset"""
+        return 0 if self.period_elapsed(now) else self.tokens_used_this_period
+
+    def has_credit(self, pricing_model: str) -> bool:
+        """Whether the company can run billable work, per pricing model"""
+        if pricing_model == PRICING_TIERED:
+            return bool(self.plan_id) and (
+                self.token_balance_usd > 0
+                or self.token_balance > 0
+                or self.has_subscription
+            )
+        if pricing_model == PRICING_PER_BED or pricing_model in SEAT_PRICING_MODELS:
+            return self.token_balance_usd > 0 or self.has_subscription
+        return self.token_balance > 0
+
+    def can_add_user(self, pricing_model: str) -> Optional[bool]:
+        """Whether the org can add a member; None when it needs a count query"""
+        if pricing_model == PRICING_TIERED:
+            if not self.plan_id:
+                return self.token_balance_usd > 0
+            # No explicit limit means unlimited
+            if self.user_limit <= 0:
+                return True
+            if self.user_count is None:
+                return None
+            return self.user_count < self.user_limit
+        if pricing_model == PRICING_PER_BED:
+            return True
+        if pricing_model == "per_capacity":
+            return self.seat_limit > 0 or self.token_balance > 0
+        if pricing_model in SEAT_PRICING_MODELS:
+            return None
+        return self.token_balance > 0
+
+    def device_check(self) -> dict:
+        limit = self.device_limit
+        can_add = self.device_count < limit if limit else True
+        return {
+            "can_add": can_add,
+            "current": self.device_count,
+            "limit": limit,
+            "message": (
+                f"Device limit reached ({self.device_count}/{limit}). Upgrade your plan to add more devices."
+                if not can_add
+                else f"{self.device_count}/{limit} devices used"
+            ),
+        }
+
+    def storage_check(self, additional_bytes: int = 0) -> dict:
+        limit = self.storage_limit_bytes
+        used = self.storage_used_bytes
+        can_add = (used + additional_bytes) <= limit if limit else True
+        return {
+            "can_add": can_add,
+            "used_bytes": used,
+            "limit_bytes": limit,
+            "used_gb": round(used / GIB, 2),
+            "limit_gb": round(limit / GIB, 2),
+            "message": (
+                "Storage limit reached. Upgrade your plan or use your own S3 storage."
+                if not can_add
+                else f"{round(used / GIB, 2)}GB / {round(limit / GIB, 2)}GB used"
+            ),
+        }
+
+    def to_cache(self) -> dict:
+        data = asdict(self)
+        if self.period_start is not None:
+            data["period_start"] = self.period_start.isoformat()
+        return data
+
+    @classmethod
+    def from_cache(cls, data: dict) -> "Entitlement":
+        data = dict(data)
+        if data.get("period_start"):
+            data["period_start"] = datetime.fromisoformat(data["period_start"])
+        return cls(**data)
+
+
+def _int(value) -> int:
+    return int(value or 0)
+
+
+def build_entitlement(
+    company, pricing_config: Optional[dict], user_count=None, org_company_ids=()
+) -> Entitlement:
+    """An entitlement from a Company row and the pricing config"""
+    limits = plan_tier(pricing_config, company.plan_id).get("limits", {})
+    return Entitlement(
+        company_id=str(company.id),
+        version=_int(getattr(company, "billing_version", 0)),
+        parent_id=str(company.company_id) if company.company_id else None,
+        plan_id=company.plan_id,
+        token_balance=_int(company.token_balance),
+        token_balance_usd=float(company.token_balance_usd or 0),
+        has_subscription=bool(
+            company.stripe_subscription_id and company.auto_topup_enabled
+        ),
+        plan_tokens=_int(limits.get("tokens")),
+        plan_users=_int(limits.get("users")),
+        plan_devices=_int(limits.get("devices")),
+        plan_storage_bytes=_int(limits.get("storage_gb")) * GIB,
+        addon_tokens=_int(company.addon_tokens),
+        addon_users=_int(company.addon_users),
+        addon_devices=_int(company.addon_devices),
+        addon_storage_bytes=_int(company.addon_storage_bytes),
+        seat_limit=_int(company.user_limit),
+        tokens_used_this_period=_int(company.tokens_used_this_period),
+        period_start=naive_utc(company.current_period_start),
+        device_count=_int(company.device_count),
+        storage_used_bytes=_int(company.storage_used_bytes),
+        user_count=user_count,
+        org_company_ids=list(org_company_ids),
+    )
+
+
+def org_company_ids(session, company_model, root_id: str) -> List[str]:
+    """`root_id` and every company below it, one query per level"""
+    ids, seen, frontier = [str(root_id)], {str(root_id)}, [root_id]
+    while frontier:
+        children = [
+            str(row[0])
+            for row in session.query(company_model.id).filter(
+                company_model.company_id.in_(frontier)
+            )
+        ]
+        frontier = [child for child in children if child not in seen]
+        seen.update(frontier)
+        ids.extend(frontier)
+    return ids
+
+
+def load_entitlement(
+    session, models: "EntitlementModels", company_id: str, pricing_config
+) -> Optional[Entitlement]:
+    company = (
+        session.query(models.company).filter(models.company.id == company_id).first()
+    )
+    if company is None:
+        return None
+    if pricing_model_of(pricing_config) != PRICING_TIERED or company.company_id:
+        return build_entitlement(company, pricing_config)
+    ids = org_company_ids(session, models.company, company.id)
+    user_count = (
+        session.query(func.count(models.user_company.id))
+        .filter(models.user_company.company_id.in_(ids))
+        .scalar()
+    )
+    return build_entitlement(company, pricing_config, _int(user_count), ids)
+
+
+def _payment_required(detail) -> HTTPException:
+    return HTTPException(status_code=402, detail=detail)
+
+
+def charge_tokens(
+    session,
+    company_model,
+    company_id: str,
+    total_tokens: int,
+    pricing_model: str,
+    plan_tokens: int = 0,
+    billing_enabled: bool = True,
+    now: Optional[datetime] = None,
+):
+    """
+    Charge `total_tokens` to a billing company in the caller's transaction.
+    Returns the row read back (billing_version, token_balance,
+    token_balance_usd, tokens_used_this_period, current_period_start,
+    tokens_used_total) or raises 402.
+
+    Tiered plans first roll the period over when it has ended, then add to
+    the period usage and take only the part over the plan's allowance
+    (`plan_tokens` plus addon tokens) from the topped-up balance. Other
+    models take the whole amount from the balance and refuse to overdraw.
+    Each step is one UPDATE evaluated against the current row, so concurrent
+    charges serialize on the row lock instead of overwriting each other.
+    """
+    company = company_model
+    now = now or utcnow()
+    version = func.coalesce(company.billing_version, 0) + 1
+    balance = func.coalesce(company.token_balance, 0)
+    returning = (
+        company.billing_version,
+        company.token_balance,
+        company.token_balance_usd,
+        company.tokens_used_this_period,
+        company.current_period_start,
+        company.tokens_used_total,
+    )
+    values = {
+        "tokens_used_total": func.coalesce(company.tokens_used_total, 0) + total_tokens,
+        "billing_version": version,
+    }
+    if pricing_model == PRICING_TIERED:
+        used = func.coalesce(company.tokens_used_this_period, 0)
+        session.execute(
+            update(company)
+            .where(
+                company.id == company_id,
+                or_(
+                    company.current_period_start.is_(None),
+                    company.current_period_start <= now - relativedelta(months=1),
+                ),
+            )
+            .values(
+                # A first charge only starts the period
+                tokens_used_this_period=case(
+                    (company.current_period_start.is_(None), used), else_=0
+                ),
+                current_period_start=now,
+                billing_version=version,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        limit = func.coalesce(company.addon_tokens, 0) + plan_tokens
+        overage = used + total_tokens - limit
+        deduction = case(
+            (or_(limit <= 0, overage <= 0, balance <= 0), 0),
+            (and_(overage >= total_tokens, balance >= total_tokens), total_tokens),
+            (overage <= balance, overage),
+            else_=balance,
+        )
+        statement = update(company).where(company.id == company_id)
+        if billing_enabled:
+            # Over the allowance with nothing to pay for it
+            statement = statement.where(
+                not_(
+                    and_(
+                        limit > 0,
+                        overage > 0,
+                        balance <= 0,
+                        func.coalesce(company.token_balance_usd, 0) <= 0,
+                    )
+                )
+            )
+        values["tokens_used_this_period"] = used + total_tokens
+        values["token_balance"] = balance - deduction
+        detail = "Monthly token limit exceeded. Purchase additional tokens ($5/1M) or upgrade your plan."
+    else:
+        statement = update(company).where(
+            company.id == company_id, balance >= total_tokens
+        )
+        values["token_balance"] = balance - total_tokens
+        detail = (
+            "Insufficient token balance. Please top up your company's token balance."
+        )
+    row = session.execute(
+        statement.values(**values)
+        .returning(*returning)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        raise _payment_required(detail)
+    return row
+
+
+@dataclass
+class EntitlementModels:
+    company: Any
+    user_company: Any
+
+
+def _default_token_price() -> float:
+    from MagicalAuth import _get_price_service
+
+    return float(_get_price_service().get_token_price())
+
+
+def _default_pricing_config() -> Optional[dict]:
+    from MagicalAuth import _get_cached_pricing_config
+
+    return _get_cached_pricing_config()
+
+
+class EntitlementEngine:
+    def __init__(
+        self,
+        cache=None,
+        session_factory: Optional[Callable] = None,
+        models: Optional[EntitlementModels] = None,
+        token_price: Optional[Callable[[], float]] = None,
+        pricing_config: Optional[Callable[[], Optional[dict]]] = None,
+        ttl: int = ENTITLEMENT_CACHE_TTL,
+        local_ttl: float = ENTITLEMENT_LOCAL_TTL,
+        membership_ttl: int = ENTITLEMENT_MEMBERSHIP_TTL,
+        settings_ttl: int = ENTITLEMENT_SETTINGS_TTL,
+        interval: int = ENTITLEMENT_RECONCILE_INTERVAL,
+    ):
+        self.cache = cache or shared_cache
+        self.session_factory = session_factory
+        self._models = models
+        self.load_token_price = token_price or _default_token_price
+        self.load_pricing_config = pricing_config or _default_pricing_config
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.membership_ttl = membership_ttl
+        self.settings_ttl = settings_ttl
+        self.interval = interval
+        # company_id -> (entitlement, expires)
+        self._local: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.running = False
+        self._task = None
+        self.stats = {
+            "checks": 0,
+            "local_hits": 0,
+            "cache_hits": 0,
+            "loads": 0,
+            "charges": 0,
+            "refusals_confirmed": 0,
+            "invalidations": 0,
+            "stale_dropped": 0,
+            "reconciles": 0,
+        }
+
+    def _session(self):
+        if self.session_factory is not None:
+            return self.session_factory()
+        from DB import get_session
+
+        return get_session()
+
+    def models(self) -> EntitlementModels:
+        if self._models is None:
+            from DB import Company, UserCompany
+
+            self._models = EntitlementModels(company=Company, user_company=UserCompany)
+        return self._models
+
+    def _with_session(self, session, fn):
+        if session is not None:
+            return fn(session)
+        session = self._session()
+        try:
+            return fn(session)
+        finally:
+            session.close()
+
+    # Settings
+
+    def settings(self) -> dict:
+        """Token price and pricing model, without the two ServerConfig reads"""
+        cached = self.cache.get("entitlements:settings")
+        if cached is None:
+            cached = {
+                "token_price": self.load_token_price(),
+                "pricing_model": pricing_model_of(self.load_pricing_config()),
+            }
+            self.cache.set("entitlements:settings", cached, ttl=self.settings_ttl)
+        return cached
+
+    def token_price(self) -> float:
+        return self.settings()["token_price"]
+
+    def billing_enabled(self) -> bool:
+        return self.token_price() > 0
+
+    def pricing_model(self) -> str:
+        return self.settings()["pricing_model"]
+
+    def invalidate_settings(self):
+        self.cache.delete("entitlements:settings")
+
+    # Memberships
+
+    def root_of(self, company_id: str, session=None) -> str:
+        """The root parent of a company, whose entitlements it bills against"""
+        company_id = str(company_id)
+        key = f"entitlements:root:{company_id}"
+        root = self.cache.get(key)
+        if root is not None:
+            return root
+        company = self.models().company
+
+        def walk(session):
+            current, visited = company_id, set()
+            while current and current not in visited:
+                visited.add(current)
+                row = (
+                    session.query(company.company_id)
+                    .filter(company.id == current)
+                    .first()
+                )
+                if row is None:
+                    break
+                if not row[0]:
+                    return current
+                current = str(row[0])
+            if current in visited and current != company_id:
+                logger.warning(f"Circular parent reference for company {company_id}")
+            return company_id
+
+        root = self._with_session(session, walk)
+        self.cache.set(key, root, ttl=self.membership_ttl)
+        return root
+
+    def membership(self, user_id: str, session=None) -> dict:
+        """
+        The user's companies, their roots and whether the user is a super
+        admin, as {"is_super_admin", "company_ids", "billing_ids"}
+        """
+        key = f"entitlements:user:{user_id}"
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        user_company = self.models().user_company
+
+        def load(session):
+            rows = (
+                session.query(user_company.company_id, user_company.role_id)
+                .filter(user_company.user_id == user_id)
+                .all()
+            )
+            company_ids = [str(row[0]) for row in rows if row[0]]
+            billing_ids = list(company_ids)
+            for company_id in company_ids:
+                root = self.root_of(company_id, session=session)
+                if root not in billing_ids:
+                    billing_ids.append(root)
+            return {
+                "is_super_admin": any(row[1] == 0 for row in rows),
+                "company_ids": company_ids,
+                "billing_ids": billing_ids,
+            }
+
+        cached = self._with_session(session, load)
+        self.cache.set(key, cached, ttl=self.membership_ttl)
+        return cached
+
+    def invalidate_user(self, user_id: str):
+        self.cache.delete(f"entitlements:user:{user_id}")
+
+    # Entries
+
+    @staticmethod
+    def cache_key(company_id: str) -> str:
+        return f"entitlements:company:{company_id}"
+
+    def _local_get(self, company_id: str) -> Optional[Entitlement]:
+        entry = self._local.get(company_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def _local_set(self, entitlement: Entitlement):
+        with self._lock:
+            current = self._local.get(entitlement.company_id)
+            if current is not None and current[0].version > entitlement.version:
+                return
+            self._local[entitlement.company_id] = (
+                entitlement,
+                time.monotonic() + self.local_ttl,
+            )
+
+    def get(self, company_id: str, session=None) -> Optional[Entitlement]:
+        """The entitlement of `company_id`, None when the company doesn't exist"""
+        company_id = str(company_id)
+        self.stats["checks"] += 1
+        entitlement = self._local_get(company_id)
+        if entitlement is not None:
+            self.stats["local_hits"] += 1
+            return entitlement
+        cached = self.cache.get(self.cache_key(company_id))
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            entitlement = Entitlement.from_cache(cached)
+            self._local_set(entitlement)
+            return entitlement
+        return self.load(company_id, session=session)
+
+    def load(self, company_id: str, session=None) -> Optional[Entitlement]:
+        """Read an entitlement from the database and cache it"""
+        pricing_config = self.load_pricing_config()
+        entitlement = self._with_session(
+            session,
+            lambda session: load_entitlement(
+                session, self.models(), company_id, pricing_config
+            ),
+        )
+        self.stats["loads"] += 1
+        if entitlement is not None:
+            self.store(entitlement)
+        return entitlement
+
+    def billing_entitlement(
+        self, company_id: str, session=None
+    ) -> Optional[Entitlement]:
+        """The entitlement of the root company `company_id` bills against"""
+        if self.get(company_id, session=session) is None:
+            return None
+        return self.get(self.root_of(company_id, session=session), session=session)
+
+    def store(self, entitlement: Entitlement):
+        """Cache `entitlement` unless a newer version is already cached"""
+        key = self.cache_key(entitlement.company_id)
+        cached = self.cache.get(key)
+        if cached is None or cached.get("version", 0) <= entitlement.version:
+            self.cache.set(key, entitlement.to_cache(), ttl=self.ttl)
+        self._local_set(entitlement)
+
+    def invalidate(self, company_id: Optional[str] = None):
+        """Drop the entitlement of one company, or all of them"""
+        self.stats["invalidations"] += 1
+        if company_id is None:
+            with self._lock:
+                self._local.clear()
+            self.cache.delete_pattern("entitlements:*")
+            return
+        company_id = str(company_id)
+        with self._lock:
+            self._local.pop(company_id, None)
+        self.cache.delete(self.cache_key(company_id))
+
+    # Hot-path checks
+
+    def has_billing_access(self, user_id: str, session=None) -> bool:
+        """
+        Whether any of the user's companies, or their roots, can pay for
+        billable work. Super admins always can.
+        """
+        membership = self.membership(user_id, session=session)
+        if membership["is_super_admin"]:
+            return True
+        pricing_model = self.pricing_model()
+        for company_id in membership["billing_ids"]:
+            entitlement = self.get(company_id, session=session)
+            if entitlement is not None and entitlement.has_credit(pricing_model):
+                return True
+        return False
+
+    def record_refusal(self):
+        """Count a refusal the database confirmed"""
+        self.stats["refusals_confirmed"] += 1
+
+    def forget_user(self, user_id: str):
+        """Drop a user's cached companies and their entitlements"""
+        cached = self.cache.get(f"entitlements:user:{user_id}")
+        for company_id in (cached or {}).get("billing_ids", ()):
+            self.invalidate(company_id)
+        self.invalidate_user(user_id)
+
+    def charge(
+        self,
+        session,
+        company_id: str,
+        total_tokens: int,
+        billing_enabled: Optional[bool] = None,
+        now: Optional[datetime] = None,
+    ) -> Optional[Entitlement]:
+        """
+        Charge tokens used by a member of `company_id` to its billing root in
+        the caller's transaction, raising 402 when the org can't pay. The new
+        entitlement is cached once the transaction commits. Returns None when
+        the company doesn't exist.
+        """
+        root_id = self.root_of(company_id, session=session)
+        entitlement = self.get(root_id, session=session)
+        if entitlement is None:
+            return None
+        if billing_enabled is None:
+            billing_enabled = self.billing_enabled()
+        row = charge_tokens(
+            session,
+            self.models().company,
+            root_id,
+            total_tokens,
+            self.pricing_model(),
+            plan_tokens=entitlement.plan_tokens,
+            billing_enabled=billing_enabled,
+            now=now,
+        )
+        self.stats["charges"] += 1
+        charged = replace(
+            entitlement,
+            version=_int(row.billing_version),
+            token_balance=_int(row.token_balance),
+            token_balance_usd=float(row.token_balance_usd or 0),
+            tokens_used_this_period=_int(row.tokens_used_this_period),
+            period_start=naive_utc(row.current_period_start),
+        )
+        _pending(session)["store"][root_id] = charged
+        return charged
+
+    # Write tracking
+
+    def watch(self, company_model, user_company_model, session_class=Session):
+        """
+        Bump `billing_version` on ORM writes to billing columns and drop the
+        affected entries once the transaction commits
+        """
+        fields = [f for f in BILLING_FIELDS if hasattr(company_model, f)]
+
+        def before_flush(session, flush_context, instances):
+            changes = None
+            for obj in session.new:
+                if isinstance(obj, user_company_model):
+                    changes = changes or _pending(session)
+                    changes["users"].add(str(obj.user_id))
+                    changes["companies"].add(str(obj.company_id))
+                elif isinstance(obj, company_model) and obj.company_id:
+                    # A new child grows the parent's org
+                    changes = changes or _pending(session)
+                    changes["companies"].add(str(obj.company_id))
+            for obj in session.deleted:
+                if isinstance(obj, user_company_model):
+                    changes = changes or _pending(session)
+                    changes["users"].add(str(obj.user_id))
+                    changes["companies"].add(str(obj.company_id))
+                elif isinstance(obj, company_model):
+                    changes = changes or _pending(session)
+                    changes["companies"].add(str(obj.id))
+            for obj in session.dirty:
+                if isinstance(obj, company_model):
+                    state = inspect(obj)
+                    if any(state.attrs[f].history.has_changes() for f in fields):
+                        obj.billing_version = _int(obj.billing_version) + 1
+                        changes = changes or _pending(session)
+                        changes["companies"].add(str(obj.id))
+                elif isinstance(obj, user_company_model):
+                    state = inspect(obj)
+                    if state.attrs.role_id.history.has_changes():
+                        changes = changes or _pending(session)
+                        changes["users"].add(str(obj.user_id))
+
+        def after_commit(session):
+            changes = session.info.pop(_PENDING_KEY, None)
+            if changes:
+                self._apply(changes)
+
+        def after_rollback(session, previous_transaction):
+            # A savepoint rolling back leaves the outer transaction's changes
+            if previous_transaction.parent is None:
+                session.info.pop(_PENDING_KEY, None)
+
+        event.listen(session_class, "before_flush", before_flush)
+        event.listen(session_class, "after_commit", after_commit)
+        event.listen(session_class, "after_soft_rollback", after_rollback)
+
+    def _apply(self, changes: dict):
+        try:
+            for user_id in changes.get("users", ()):
+                self.invalidate_user(user_id)
+            for company_id in changes.get("companies", ()):
+                self.invalidate(company_id)
+                # Member counts are kept on the root
+                root = self.cache.get(f"entitlements:root:{company_id}")
+                if root is not None and root != company_id:
+                    self.invalidate(root)
+            for entitlement in changes.get("store", {}).values():
+                if entitlement.company_id not in changes.get("companies", ()):
+                    self.store(entitlement)
+        except Exception as e:
+            logger.warning(f"Could not update cached entitlements: {e}")
+
+    # Reconcile
+
+    def reconcile(self) -> dict:
+        """
+        Drop cached entries whose version no longer matches the database.
+        Checks the entries this worker used since the last reconcile.
+        """
+        with self._lock:
+            cached = {}
+            for company_id, entry in self._local.items():
+                shared = self.cache.get(self.cache_key(company_id))
+                cached[company_id] = (
+                    shared.get("version", 0) if shared else entry[0].version
+                )
+        checked = stale = 0
+        if cached:
+            company = self.models().company
+            session = self._session()
+            try:
+                ids = list(cached)
+                for start in range(0, len(ids), 500):
+                    batch = ids[start : start + 500]
+                    versions = {
+                        str(row[0]): _int(row[1])
+                        for row in session.query(
+                            company.id, company.billing_version
+                        ).filter(company.id.in_(batch))
+                    }
+                    for company_id in batch:
+                        checked += 1
+                        if versions.get(company_id) != cached[company_id]:
+                            stale += 1
+                            self.invalidate(company_id)
+            finally:
+                session.close()
+        now = time.monotonic()
+        with self._lock:
+            for company_id in [c for c, e in self._local.items() if e[1] < now]:
+                del self._local[company_id]
+        self.stats["reconciles"] += 1
+        self.stats["stale_dropped"] += stale
+        return {"checked": checked, "stale": stale}
+
+    async def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self.running = False
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _loop(self):
+        while self.running:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.reconcile)
+            except Exception as e:
+                logger.error(f"Entitlement reconcile failed: {e}")
+
+    def get_stats(self) -> dict:
+        checks = self.stats["checks"]
+        hits = self.stats["local_hits"] + self.stats["cache_hits"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / checks, 4) if checks else 0.0,
+            "local_entries": len(self._local),
+        }
+
+
+entitlements = EntitlementEngine()
@@ -524,7 +524,7 @@ class Extensions:
             if key not in kwargs or kwargs[key] is None:
                 kwargs[key] = value
 
-        return self.ApiClient.run_chain(
+        return await self.ApiClient.run_chain_async(
             chain_name=chain_name,
             user_input=user_input,
             agent_name=self.agent_name,  # Use the current agent executing the chain
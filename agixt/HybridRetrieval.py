@@ -0,0 +1,379 @@
+"""
+HybridRetrieval - Lexical plus vector memory search with rank fusion
+
+Cosine similarity alone misses exact identifiers, error codes and names that
+embed poorly. Memory search therefore runs two queries side by side:
+
+- a lexical query over Memory.text using the database's full-text index
+  (SQLite FTS5 ranked by bm25, PostgreSQL tsvector ranked by ts_rank_cd)
+- the existing vector query
+
+and merges the two rankings with reciprocal rank fusion, which needs no score
+calibration between the very different scales of bm25 and cosine similarity.
+
+Both queries accept the same MemoryFilters (external source and timestamp).
+This module only issues SQL against the `memory` table, so it does not import
+DB and can be pointed at any SQLAlchemy session.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+logger = logging.getLogger(__name__)
+
+# Standard RRF constant; larger values flatten the contribution of top ranks
+RRF_K = 60
+
+# Each side of the hybrid query fetches this many candidates per result wanted
+CANDIDATE_MULTIPLIER = 4
+MIN_CANDIDATES = 20
+
+# Query terms beyond this are dropped to keep the MATCH expression bounded
+MAX_QUERY_TERMS = 32
+
+# A memory found only by the full-text query (which matches ANY term) must
+# contain at least this fraction of the query terms, unless its cosine
+# similarity already clears the caller's relevance floor. bm25 and ts_rank_cd
+# scores are not comparable across backends, so coverage is the lexical floor.
+MIN_LEXICAL_TERM_COVERAGE = 0.5
+
+SQLITE_FTS_TABLE = "memory_fts"
+POSTGRES_FTS_INDEX = "ix_memory_text_fts"
+
+_STOPWORDS = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "as",
+    "at",
+    "be",
+    "by",
+    "did",
+    "do",
+    "does",
+    "for",
+    "from",
+    "how",
+    "i",
+    "in",
+    "is",
+    "it",
+    "me",
+    "my",
+    "of",
+    "on",
+    "or",
+    "that",
+    "the",
+    "this",
+    "to",
+    "was",
+    "we",
+    "what",
+    "when",
+    "where",
+    "which",
+    "who",
+    "why",
+    "with",
+    "you",
+}
+
+# Words, plus compound identifiers such as ERR_CONN_RESET, user-029, v1.2.3
+_TERM_PATTERN = re.compile(r"\w+(?:[-.:/]\w+)*")
+
+
+@dataclass
+class MemoryFilters:
+    """Metadata restrictions applied to both lexical and vector search"""
+
+    external_sources: Optional[Sequence[str]] = None
+    external_source_prefix: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    @property
+    def empty(self) -> bool:
+        return not (
+            self.external_sources
+            or self.external_source_prefix
+            or self.since
+            or self.until
+        )
+
+
+def query_terms(query: str) -> List[str]:
+    """Distinct search terms from a free-text query, in order"""
+    terms = []
+    seen = set()
+    for match in _TERM_PATTERN.finditer(query.lower()):
+        term = match.group(0)
+        if term in seen or term in _STOPWORDS:
+            continue
+        if len(term) == 1 and not term.isdigit():
+            continue
+        seen.add(term)
+        terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def term_coverage(terms: Sequence[str], text: str) -> float:
+    """Fraction of the query terms that occur as terms of the text"""
+    if not terms:
+        return 0.0
+    found = set()
+    for match in _TERM_PATTERN.finditer(text.lower()):
+        term = match.group(0)
+        found.add(term)
+        # Compound identifiers also count for their parts
+        found.update(re.split(r"[-.:/]", term))
+    return sum(1 for term in terms if term in found) / len(terms)
+
+
+def fts5_match_expression(terms: Iterable[str]) -> str:
+    """OR of quoted terms; compound terms become FTS5 phrases"""
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _filter_clauses(filters: Optional[MemoryFilters], params: dict) -> List[str]:
+    clauses = []
+    if not filters:
+        return clauses
+    if filters.external_sources:
+        clauses.append("m.external_source IN :external_sources")
+        params["external_sources"] = list(filters.external_sources)
+    if filters.external_source_prefix:
+        clauses.append("m.external_source LIKE :external_source_prefix ESCAPE '\\'")
+        params["external_source_prefix"] = (
+            _escape_like(filters.external_source_prefix) + "%"
+        )
+    if filters.since:
+        clauses.append("m.timestamp >= :since")
+        params["since"] = filters.since
+    if filters.until:
+        clauses.append("m.timestamp <= :until")
+        params["until"] = filters.until
+    return clauses
+
+
+def apply_memory_filters(query, model, filters: Optional[MemoryFilters]):
+    """Apply MemoryFilters to an ORM query over the Memory model"""
+    if not filters:
+        return query
+    if filters.external_sources:
+        query = query.filter(model.external_source.in_(list(filters.external_sources)))
+    if filters.external_source_prefix:
+        query = query.filter(
+            model.external_source.startswith(
+                filters.external_source_prefix, autoescape=True
+            )
+        )
+    if filters.since:
+        query = query.filter(model.timestamp >= filters.since)
+    if filters.until:
+        query = query.filter(model.timestamp <= filters.until)
+    return query
+
+
+def ensure_memory_text_index(session, rebuild: bool = False) -> bool:
+    """
+    Create the full-text index over memory.text if it does not exist.
+
+    SQLite gets an external-content FTS5 table kept in sync by triggers and is
+    backfilled once; PostgreSQL gets a GIN index on to_tsvector('simple', text).
+    Pass rebuild=True to repopulate the SQLite index (needed after a manual
+    VACUUM, which may renumber rowids). Returns True if the index is usable.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        exists = session.execute(
+            text("SELECT name FROM sqlite_master WHERE type='table' AND name=:name"),
+            {"name": SQLITE_FTS_TABLE},
+        ).fetchone()
+        if not exists:
+            session.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5("
+                    "text, content='memory', content_rowid='rowid', "
+                    "tokenize=\"unicode61 tokenchars '_'\")"
+                )
+            )
+            rebuild = True
+        session.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON memory BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, text) VALUES (new.rowid, new.text); END"
+            )
+        )
+        session.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON memory BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, text) "
+                "VALUES ('delete', old.rowid, old.text); END"
+            )
+        )
+        session.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au AFTER UPDATE OF text ON memory BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, text) "
+                "VALUES ('delete', old.rowid, old.text); "
+                f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, text) VALUES (new.rowid, new.text); END"
+            )
+        )
+        if rebuild:
+            session.execute(
+                text(
+                    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')"
+                )
+            )
+        session.commit()
+        return True
+    if dialect == "postgresql":
+        session.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_FTS_INDEX} ON memory "
+                "USING gin (to_tsvector('simple', text))"
+            )
+        )
+        session.commit()
+        return True
+    logger.info(f"No full-text memory index for {dialect}")
+    return False
+
+
+def lexical_search(
+    session,
+    query: str,
+    agent_id,
+    conversation_id=None,
+    limit: int = 20,
+    filters: Optional[MemoryFilters] = None,
+) -> List[Tuple[str, float]]:
+    """
+    Rank memories by full-text relevance to the query.
+
+    Scope matches vector search: the agent's core memories plus, when given,
+    one conversation's memories. Returns (memory_id, score) best first, where
+    a higher score is better on both backends.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    params: Dict[str, Any] = {"agent_id": agent_id, "limit": limit}
+    clauses = ["m.agent_id = :agent_id"]
+    if conversation_id:
+        clauses.append("(m.conversation_id IS NULL OR m.conversation_id = :cid)")
+        params["cid"] = conversation_id
+    else:
+        clauses.append("m.conversation_id IS NULL")
+    clauses += _filter_clauses(filters, params)
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        params["match"] = fts5_match_expression(terms)
+        sql = (
+            f"SELECT m.id, -bm25({SQLITE_FTS_TABLE}) AS score "
+            f"FROM {SQLITE_FTS_TABLE} JOIN memory m ON m.rowid = {SQLITE_FTS_TABLE}.rowid "
+            f"WHERE {SQLITE_FTS_TABLE} MATCH :match AND "
+            + " AND ".join(clauses)
+            + " ORDER BY score DESC LIMIT :limit"
+        )
+    elif dialect == "postgresql":
+        tsquery = " || ".join(
+            f"plainto_tsquery('simple', :t{i})" for i in range(len(terms))
+        )
+        params.update({f"t{i}": term for i, term in enumerate(terms)})
+        sql = (
+            "SELECT m.id, ts_rank_cd(to_tsvector('simple', m.text), fts.q) AS score "
+            f"FROM memory m, (SELECT {tsquery} AS q) fts "
+            "WHERE to_tsvector('simple', m.text) @@ fts.q AND "
+            + " AND ".join(clauses)
+            + " ORDER BY score DESC LIMIT :limit"
+        )
+    else:
+        return []
+    statement = text(sql)
+    if "external_sources" in params:
+        statement = statement.bindparams(bindparam("external_sources", expanding=True))
+    try:
+        rows = session.execute(statement, params).fetchall()
+    except Exception as e:
+        # A missing index or unsupported query must not break memory recall
+        session.rollback()
+        logger.warning(f"Lexical memory search unavailable: {e}")
+        return []
+    return [(str(row[0]), float(row[1])) for row in rows]
+
+
+def rank_by_similarity(
+    query_embedding,
+    candidates: Sequence[Tuple[Any, Any]],
+    limit: int,
+    min_score: float = 0.0,
+) -> List[Tuple[Any, float]]:
+    """
+    Cosine similarity of one query against many (key, embedding) pairs at once.
+
+    Embeddings whose size differs from the query's are skipped. Returns the
+    top `limit` (key, similarity) pairs at or above `min_score`, best first.
+    """
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    query_norm = np.linalg.norm(query)
+    if query_norm == 0 or not candidates:
+        return []
+    keys = []
+    vectors = []
+    for key, embedding in candidates:
+        if embedding is None:
+            continue
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape != query.shape:
+            continue
+        keys.append(key)
+        vectors.append(vector)
+    if not vectors:
+        return []
+    matrix = np.vstack(vectors)
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = np.inf
+    scores = (matrix @ query) / (norms * query_norm)
+    order = np.argsort(-scores, kind="stable")
+    results = []
+    for index in order:
+        score = float(scores[index])
+        if score < min_score or len(results) >= limit:
+            break
+        results.append((keys[index], score))
+    return results
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Any]],
+    k: int = RRF_K,
+    weights: Optional[Sequence[float]] = None,
+) -> List[Tuple[Any, float]]:
+    """
+    Merge ranked lists of keys: score(d) = sum of weight / (k + rank(d)).
+
+    Ranks start at 1. Ties keep the order in which keys were first seen.
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[Any, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def candidate_count(limit: int) -> int:
+    return max(limit * CANDIDATE_MULTIPLIER, MIN_CANDIDATES)
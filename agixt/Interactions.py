@@ -7,12 +7,20 @@ import logging
 import base64
 import uuid
 import asyncio
+import hashlib
 from datetime import datetime
 from fastapi import HTTPException
 from Memories import Memories
 from Websearch import Websearch
 from Extensions import Extensions
 from Memories import extract_keywords
+from Summarization import MapReduceSummarizer
+from ContextPacker import (
+    TRIM_OLDEST,
+    ContextItem,
+    ContextSection,
+    context_packer,
+)
 from ApiClient import (
     Agent,
     Prompts,
@@ -29,6 +37,7 @@ from MagicalAuth import (
 from Globals import getenv, DEFAULT_USER, get_tokens
 from WebhookManager import WebhookEventEmitter
 from middleware import log_silenced_exception
+from WorkerRegistry import worker_registry
 
 
 logging.basicConfig(
@@ -710,7 +719,9 @@ async def stream_inference_to_string(agent, prompt: str, **kwargs) -> str:
     output_tokens = get_tokens(result)
     try:
         agent.auth.increase_token_counts(
-            input_tokens=input_tokens, output_tokens=output_tokens
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            agent_id=agent.agent_id,
         )
     except Exception:
         pass  # Don't fail on billing tracking errors
@@ -1159,15 +1170,19 @@ class Interactions:
         self._total_dedup_count = 0
         self._last_iteration_dedup_count = 0
 
-    def _check_cancelled(self):
+    def _check_cancelled(self, conversation_id: str = None):
         """
-        Check if the current asyncio task has been cancelled.
+        Check if the current asyncio task has been cancelled, or the
+        conversation stopped (from any worker).
         Raises asyncio.CancelledError if the task was cancelled.
         This allows graceful stopping of long-running operations.
         """
         task = asyncio.current_task()
         if task and task.cancelled():
             raise asyncio.CancelledError("Task was cancelled by user")
+        # An in-memory set lookup, cheap enough to call while streaming
+        if conversation_id and worker_registry.is_stopped(conversation_id):
+            raise asyncio.CancelledError("Conversation was stopped by user")
 
     # Directories that are noisy / huge and should be collapsed in the
     # workspace file tree shown to the agent. The directory itself is still
@@ -1368,7 +1383,10 @@ class Interactions:
         conversation_outputs = (
             f"http://localhost:7437/outputs/{self.agent.agent_id}/{conversation_id}/"
         )
+        # The context is gathered as sections in prompt order, then packed into
+        # the token budget once the fixed costs (prompt, input, commands) are known
         context = []
+        memories = []
         if int(top_results) > 0:
             if user_input:
                 min_relevance_score = 0.2
@@ -1377,10 +1395,12 @@ class Interactions:
                         min_relevance_score = float(kwargs["min_relevance_score"])
                     except:
                         min_relevance_score = 0.2
-                context += await self.agent_memory.get_memories(
-                    user_input=user_input,
-                    limit=top_results,
-                    min_relevance_score=min_relevance_score,
+                memories.append(
+                    await self.agent_memory.get_memories(
+                        user_input=user_input,
+                        limit=top_results,
+                        min_relevance_score=min_relevance_score,
+                    )
                 )
                 # Default to injecting from collection 0 if no specific collection is specified
                 # This provides additional memories from collection 0 beyond what agent_memory provides
@@ -1404,44 +1424,36 @@ class Interactions:
                     )
                     # Only add if we got different memories to avoid complete duplicates
                     if additional_memories:
-                        context += additional_memories
+                        memories.append(additional_memories)
                 except Exception as e:
                     logging.error(
                         f"Error: {self.agent_name} failed to get memories from collection {collection_id}. {e}"
                     )
+                # Up to four times as many conversation memories, best first,
+                # while they fit in 4000 tokens
                 conversation_context = await self.websearch.agent_memory.get_memories(
                     user_input=user_input,
-                    limit=top_results,
+                    limit=int(top_results) * 4,
                     min_relevance_score=min_relevance_score,
+                    token_budget=4000,
                 )
-                if len(conversation_context) == int(top_results):
-                    conversational_context_tokens = get_tokens(
-                        " ".join(conversation_context)
-                    )
-                    if int(conversational_context_tokens) < 4000:
-                        conversational_results = top_results * 2
-                        conversation_context = (
-                            await self.websearch.agent_memory.get_memories(
-                                user_input=user_input,
-                                limit=conversational_results,
-                                min_relevance_score=min_relevance_score,
-                            )
-                        )
-                        conversational_context_tokens = get_tokens(
-                            " ".join(conversation_context)
-                        )
-                        if int(conversational_context_tokens) < 4000:
-                            conversational_results = conversational_results * 2
-                            conversation_context = (
-                                await self.websearch.agent_memory.get_memories(
-                                    user_input=user_input,
-                                    limit=conversational_results,
-                                    min_relevance_score=min_relevance_score,
-                                )
-                            )
-                context += conversation_context
+                memories.append(conversation_context)
+        # Within each search the best match comes first; across searches the
+        # nth result of each is worth the same
+        context.append(
+            ContextSection(
+                name="memories",
+                items=[
+                    ContextItem(memory, score=1 / (1 + rank))
+                    for results in memories
+                    for rank, memory in enumerate(results)
+                ],
+                priority=2,
+                share=0.2,
+            )
+        )
         if "context" in kwargs:
-            context.append(kwargs["context"])
+            context.append(ContextSection.text("context", kwargs["context"]))
         include_sources = (
             str(kwargs["include_sources"]).lower() == "true"
             if "include_sources" in kwargs
@@ -1449,9 +1461,11 @@ class Interactions:
         )
         if include_sources:
             sources = []
-            for line in context:
-                if "Content from" in line:
-                    source = line.split("Content from ")[1].split("\n")[0]
+            for line in [memory for results in memories for memory in results] + [
+                kwargs.get("context", "")
+            ]:
+                if "Content from" in str(line):
+                    source = str(line).split("Content from ")[1].split("\n")[0]
                     if f"Content from {source}" not in sources:
                         sources.append(f"Content from {source}")
             if sources != []:
@@ -1481,8 +1495,14 @@ class Interactions:
                 conversation_results = 5
         agent_tasks = self.agent.get_conversation_tasks(conversation_id=conversation_id)
         if agent_tasks != "":
-            context.append(agent_tasks)
+            context.append(ContextSection.text("tasks", agent_tasks))
         conversation_history = ""
+        history_section = ContextSection(
+            name="conversation_history", priority=1, share=0.3, trim=TRIM_OLDEST
+        )
+        activities_section = ContextSection(
+            name="activities", priority=3, share=0.1, trim=TRIM_OLDEST, separator="\n\n"
+        )
         # Fetch a wider window than the default to avoid silently dropping
         # relevant turns in longer chats before we apply our own slicing.
         history_fetch_limit = max(200, min(2000, conversation_results * 20))
@@ -1532,24 +1552,32 @@ class Interactions:
                         interactions.append(f"{timestamp} {role}: {message} \n ")
                 if len(interactions) > 0:
                     interactions = interactions[-conversation_results:]
-                    conversation_history = "\n".join(interactions)
-                conversation_history += "\n## The assistant's recent activities:\n"
+                    history_section.items = [
+                        ContextItem(interaction) for interaction in interactions
+                    ]
                 activity_window = max(12, min(80, conversation_results * 4))
                 subactivity_window = max(6, min(20, conversation_results * 2))
-                conversation_history += c.get_activities_with_subactivities(
+                recent_activities = c.get_activities_with_subactivities(
                     max_activities=activity_window,
                     max_subactivities_per_activity=subactivity_window,
                 )
-        if conversation_history != "":
-            context.append(
-                f"### Recent Activities and Conversation History\n{conversation_history}\n"
-            )
+                if recent_activities:
+                    # A header line, then one block per activity, oldest first
+                    header, _, blocks = recent_activities.partition("\n")
+                    activities_section.prefix = f"{header}\n"
+                    activities_section.items = [
+                        ContextItem(block) for block in blocks.split("\n\n")
+                    ]
+                context += [history_section, activities_section]
         # Inject conversation summary for long-term memory / alignment
         try:
             conversation_summary = c.get_conversation_summary()
             if conversation_summary:
                 context.append(
-                    f"### Conversation Summary\nThe following is a living summary of this conversation capturing key topics, user preferences, lessons learned, and important context:\n{conversation_summary}\n"
+                    ContextSection.text(
+                        "summary",
+                        f"### Conversation Summary\nThe following is a living summary of this conversation capturing key topics, user preferences, lessons learned, and important context:\n{conversation_summary}\n",
+                    )
                 )
         except Exception as e:
             log_silenced_exception(e, "format_prompt: getting conversation summary")
@@ -1560,7 +1588,10 @@ class Interactions:
                 user_knowledge = get_user_knowledge(user_id)
                 if user_knowledge:
                     context.append(
-                        f"### User Knowledge\nThe following are observations about this user gathered over time across conversations. Use this to personalize responses and remember important details about them:\n{user_knowledge}\n"
+                        ContextSection.text(
+                            "user_knowledge",
+                            f"### User Knowledge\nThe following are observations about this user gathered over time across conversations. Use this to personalize responses and remember important details about them:\n{user_knowledge}\n",
+                        )
                     )
         except Exception as e:
             log_silenced_exception(e, "format_prompt: getting user knowledge")
@@ -1593,53 +1624,112 @@ class Interactions:
                             min_relevance_score=0.3,
                         )
                         if company_memories:
-                            for metadata in company_memories:
-                                if metadata not in context and metadata != "":
-                                    context.append(metadata)
+                            recalled = {
+                                memory for results in memories for memory in results
+                            }
+                            context.append(
+                                ContextSection(
+                                    name="company_memories",
+                                    items=[
+                                        ContextItem(metadata, score=1 / (1 + rank))
+                                        for rank, metadata in enumerate(
+                                            company_memories
+                                        )
+                                        if metadata not in recalled and metadata != ""
+                                    ],
+                                    priority=4,
+                                    share=0.05,
+                                )
+                            )
                 except Exception as mem_e:
                     log_silenced_exception(
                         mem_e, "format_prompt: getting company agent memories"
                     )
         except Exception as e:
             log_silenced_exception(e, "format_prompt: getting company training data")
-        context.append(self.auth.get_markdown_companies())
+        context.append(
+            ContextSection.text("companies", self.auth.get_markdown_companies())
+        )
         if persona != "":
             context.append(
-                f"## Persona\n**The assistant follows a persona and uses the following guidelines and information to remain in character.**\n{persona}\nThe assistant is {self.agent_name} and is an AGiXT agent created by DevXT, empowered with AGiXT abilities."
+                ContextSection.text(
+                    "persona",
+                    f"## Persona\n**The assistant follows a persona and uses the following guidelines and information to remain in character.**\n{persona}\nThe assistant is {self.agent_name} and is an AGiXT agent created by DevXT, empowered with AGiXT abilities.",
+                )
             )
         APP_URI = getenv("APP_URI")
         if "localhost:" not in APP_URI:
             context.append(
-                f"The assistant is an AGiXT agent named `{self.agent_name}` running on {APP_URI}. The assistant can access the documentation about the website at {AGIXT_URI}/docs as well as information about the open source AGiXT back end repository at https://github.com/Josh-XT/AGiXT if necessary."
+                ContextSection.text(
+                    "platform",
+                    f"The assistant is an AGiXT agent named `{self.agent_name}` running on {APP_URI}. The assistant can access the documentation about the website at {AGIXT_URI}/docs as well as information about the open source AGiXT back end repository at https://github.com/Josh-XT/AGiXT if necessary.",
+                )
             )
-        if "72" in kwargs and "42" in kwargs:
-            if kwargs["72"] == True and kwargs["42"] == True:
-                kwargs["fp"] = context
         if "uploaded_file_data" in kwargs:
             context.append(
-                f"The user uploaded these files for the assistant to analyze:\n{kwargs['uploaded_file_data']}\n"
+                ContextSection.text(
+                    "uploaded_files",
+                    f"The user uploaded these files for the assistant to analyze:\n{kwargs['uploaded_file_data']}\n",
+                )
             )
         # Always include workspace file tree so the agent knows what files exist
         # This applies to both initial uploads AND follow-up requests
         if "workspace_file_context" in kwargs and kwargs["workspace_file_context"]:
             workspace_file_info = kwargs["workspace_file_context"]
             context.append(
-                f"## Files in Workspace\nThe following files are available in the assistant's workspace directory and can be accessed using file operation commands (Read File, Write to File, Modify File, Delete File, List Directory, Search Files, Search File Content, Grep Search, Execute Python File, Run Data Analysis, Execute Python Code):\n{workspace_file_info}\n\n**IMPORTANT: When using file commands, use ONLY the relative path from the tree above.** For example, if the tree shows `CandleLaunchGame/src/App.tsx`, use `CandleLaunchGame/src/App.tsx` as the filename — do NOT prepend `/agixt/`, `/workspace/`, `WORKSPACE/`, or any absolute path. The system automatically resolves relative paths to the correct location.\n"
+                ContextSection.text(
+                    "workspace_files",
+                    f"## Files in Workspace\nThe following files are available in the assistant's workspace directory and can be accessed using file operation commands (Read File, Write to File, Modify File, Delete File, List Directory, Search Files, Search File Content, Grep Search, Execute Python File, Run Data Analysis, Execute Python Code):\n{workspace_file_info}\n\n**IMPORTANT: When using file commands, use ONLY the relative path from the tree above.** For example, if the tree shows `CandleLaunchGame/src/App.tsx`, use `CandleLaunchGame/src/App.tsx` as the filename — do NOT prepend `/agixt/`, `/workspace/`, `WORKSPACE/`, or any absolute path. The system automatically resolves relative paths to the correct location.\n",
+                )
             )
         if vision_response != "":
             context.append(
-                f"The assistant's visual description from viewing uploaded images by user in this interaction:\n{vision_response}\n"
+                ContextSection.text(
+                    "vision",
+                    f"The assistant's visual description from viewing uploaded images by user in this interaction:\n{vision_response}\n",
+                )
             )
         if "data_analysis" in kwargs:
             context.append(
-                f"The assistant's data analysis from the user's input and file uploads:\n{kwargs['data_analysis']}\n"
+                ContextSection.text(
+                    "data_analysis",
+                    f"The assistant's data analysis from the user's input and file uploads:\n{kwargs['data_analysis']}\n",
+                )
             )
-        if context != [] and context != "":
-            if isinstance(context, list):
-                context = "\n".join(context)
-            context = f"The user's input causes the assistant to recall these memories from activities:\n{context}\n\n**If referencing a file or image from context to the user, link to it with a url at `{conversation_outputs}the_file_name` - The URL is accessible to the user. If the file has not been referenced in context or from activities, do not attempt to link to it as it may not exist. Use exact file names and links from context only.** If linking an image, use the format `![alt_text](URL). The assistant can render HTML in chat including using javascript and threejs just by using an HTML code block.`\n"
-        else:
-            context = ""
+        context_sections = context
+
+        def assemble_context(texts: dict):
+            """The context and conversation_history prompt values from section texts"""
+            entries = []
+            history = ""
+            for section in context_sections:
+                if section.name == "activities":
+                    continue
+                if section.name == "conversation_history":
+                    history = (
+                        f"{texts.get('conversation_history', '')}\n"
+                        "## The assistant's recent activities:\n"
+                        f"{texts.get('activities', '')}"
+                    )
+                    entries.append(
+                        f"### Recent Activities and Conversation History\n{history}\n"
+                    )
+                elif texts.get(section.name):
+                    entries.append(texts[section.name])
+            if "72" in kwargs and "42" in kwargs:
+                if kwargs["72"] == True and kwargs["42"] == True:
+                    kwargs["fp"] = entries
+            if not entries:
+                return "", history
+            joined = "\n".join(entries)
+            return (
+                f"The user's input causes the assistant to recall these memories from activities:\n{joined}\n\n**If referencing a file or image from context to the user, link to it with a url at `{conversation_outputs}the_file_name` - The URL is accessible to the user. If the file has not been referenced in context or from activities, do not attempt to link to it as it may not exist. Use exact file names and links from context only.** If linking an image, use the format `![alt_text](URL). The assistant can render HTML in chat including using javascript and threejs just by using an HTML code block.`\n",
+                history,
+            )
+
+        context, conversation_history = assemble_context(
+            {section.name: section.render() for section in context_sections}
+        )
         file_contents = ""
         if "import_files" in prompt_args:
             # import_files should be formatted like [{"file_name": "file_content"}]
@@ -1758,42 +1848,28 @@ class Interactions:
                     f"This may exceed context budget."
                 )
 
-        # Check if context needs reduction before building final prompt
-        # Estimate tokens from variable-size context components
-        context_str = "\n".join(context) if isinstance(context, list) else str(context)
-        estimated_context_tokens = get_tokens(
-            f"{prompt}{user_input}{context_str}{conversation_history}{agent_commands}{file_contents}"
+        # Pack the context into what the prompt, input and commands leave of
+        # the budget. Memories and history are trimmed by relevance and recency;
+        # the LLM reducer only runs when the untrimmable sections do not fit.
+        fixed_tokens = context_packer.count(f"{prompt}{user_input}{agent_commands}")
+        packed, packing_report = context_packer.pack(
+            context_sections
+            + [ContextSection.text("file_contents", file_contents, priority=2)],
+            budget=max_context_tokens,
+            fixed_tokens=fixed_tokens,
         )
-
-        if estimated_context_tokens > max_context_tokens:
-            # Build context sections dict for reduce_context
-            context_sections = {
-                "memories": context_str,  # Already retrieved memories as string
-                "conversation_history": conversation_history,
-                "file_contents": file_contents,
-            }
-
-            # Reduce context using intelligent selection
-            reduced = await self.reduce_context(
-                user_input=user_input,
-                context_sections=context_sections,
-                target_tokens=max_context_tokens,
-                conversation_name=conversation_name,
-            )
-
-            # Apply reduced context
-            if "memories" in reduced:
-                old_context_len = len(context_str)
-                context = [reduced["memories"]] if reduced["memories"] else []
-                new_context_len = len(reduced["memories"]) if reduced["memories"] else 0
-            if "conversation_history" in reduced:
-                conversation_history = reduced["conversation_history"]
-            if "file_contents" in reduced:
-                file_contents = reduced["file_contents"]
-
-            new_tokens = get_tokens(
-                f"{prompt}{user_input}{context_str}{conversation_history}{agent_commands}{file_contents}"
-            )
+        if not packing_report.fits:
+            if packing_report.needs_reduction:
+                context_packer.record_llm_reduction(packing_report)
+                packed = await self.reduce_context(
+                    user_input=user_input,
+                    context_sections=packed,
+                    target_tokens=max(0, max_context_tokens - fixed_tokens),
+                    conversation_name=conversation_name,
+                )
+            context, conversation_history = assemble_context(packed)
+            file_contents = packed.get("file_contents", "")
+        logging.info(packing_report.summary())
         user_datetime = get_current_user_time(user_id=self.user_id).strftime(
             "%B %d, %Y %I:%M %p"
         )
@@ -2444,6 +2520,7 @@ Example: memories, persona, files"""
         # compress older/less-relevant blocks into concise summaries that preserve
         # key facts while dramatically reducing token count.
         if reduced_tokens > target_tokens:
+            candidates = []
             for section_name in [
                 "memories",
                 "activities",
@@ -2462,108 +2539,152 @@ Example: memories, persona, files"""
                 section_tok = get_tokens(section_text)
                 if section_tok < 2000:
                     continue  # Not worth summarizing small sections
+                candidates.append((section_name, content, section_text, section_tok))
 
-                # Calculate how much this section needs to shrink
-                overage = reduced_tokens - target_tokens
-                target_section_tokens = max(1000, section_tok - overage)
+            async def fast_inference(prompt: str) -> str:
+                if ability_selection_server:
+                    return await _ability_selection_inference(
+                        server_url=ability_selection_server,
+                        model=ability_selection_model,
+                        prompt=prompt,
+                    )
+                return await stream_inference_to_string(self.agent, prompt=prompt)
 
-                summary_prompt = f"""Summarize the following {section_name} context concisely for an AI assistant.
+            def summary_prompt(section_name: str, text: str, target: int) -> str:
+                return f"""Summarize the following {section_name} context concisely for an AI assistant.
 Preserve key facts, recent actions, decisions, and any information that would be needed to continue the current task.
 Drop redundant details, verbose tool outputs, and repetitive entries.
-Target approximately {target_section_tokens} tokens.
+Target approximately {target} tokens.
 
 ## Current User Request
 {user_input[:300]}
 
 ## {section_name.replace('_', ' ').title()} to Summarize
-{section_text[:80000]}
+{text}
 
 Respond with ONLY the condensed summary, no preamble."""
 
-                try:
-                    if ability_selection_server:
-                        summary = await _ability_selection_inference(
-                            server_url=ability_selection_server,
-                            model=ability_selection_model,
-                            prompt=summary_prompt,
+            # Every large section is asked to shed its share of the overage,
+            # and all of them are summarized at once rather than in turn
+            overage = reduced_tokens - target_tokens
+            candidate_tokens = sum(candidate[3] for candidate in candidates) or 1
+
+            async def summarize_section(section_name, section_text, section_tok):
+                target_section_tokens = max(
+                    1000, int(section_tok - overage * section_tok / candidate_tokens)
+                )
+                if len(section_text) <= 80000:
+                    summary = await fast_inference(
+                        summary_prompt(
+                            section_name, section_text, target_section_tokens
                         )
-                    else:
-                        summary = await stream_inference_to_string(
-                            self.agent, prompt=summary_prompt
+                    )
+                    return summary, target_section_tokens
+
+                # Too large for one call: summarize its chunks concurrently and
+                # reduce them, instead of cutting the section off at 80k chars
+                async def summarize_part(text: str, stage: str) -> str:
+                    part_target = target_section_tokens
+                    if stage == "map":
+                        part_target = max(
+                            300,
+                            int(target_section_tokens * get_tokens(text) / section_tok),
                         )
+                    return await fast_inference(
+                        summary_prompt(section_name, text, part_target)
+                    )
 
-                    if summary and len(summary) > 50:
-                        new_tokens = get_tokens(summary)
-                        # Quality guard: if the summarizer collapsed the
-                        # section to under 25% of the requested target, the
-                        # output is almost certainly lossy beyond usefulness
-                        # (observed: 17,438 -> 422 tokens, 97.6% loss). Reject
-                        # and fall through to bounded truncation instead so we
-                        # preserve actionable detail (e.g. flux numbers,
-                        # persona-driven analysis rules).
-                        min_acceptable = max(500, int(target_section_tokens * 0.25))
-                        if (
-                            new_tokens < min_acceptable
-                            and section_tok > min_acceptable * 4
-                        ):
-                            logging.warning(
-                                f"[reduce_context] Rejecting over-aggressive "
-                                f"summary for {section_name}: {section_tok} -> "
-                                f"{new_tokens} tokens (target ~{target_section_tokens}, "
-                                f"min acceptable {min_acceptable}). Falling back "
-                                f"to bounded truncation."
-                            )
-                            # Force the fallback path below
-                            summary = ""
-                            new_tokens = section_tok
-                        saved = section_tok - new_tokens
-                        if summary and saved > 0:
-                            reduced_context[section_name] = summary
-                            reduced_tokens -= saved
-                            logging.info(
-                                f"[reduce_context] Summarized {section_name}: {section_tok} -> {new_tokens} tokens (saved {saved})"
-                            )
-                    if not summary or len(summary) <= 50:
-                        # Summarization failed, fall back to truncation
-                        if isinstance(content, list) and len(content) > 3:
-                            if section_name in [
-                                "activities",
-                                "conversation",
-                                "conversation_history",
-                            ]:
-                                reduced_context[section_name] = content[-5:]
-                            else:
-                                reduced_context[section_name] = content[:5]
-                            new_tokens = get_tokens(
-                                "\n".join(
-                                    str(item) for item in reduced_context[section_name]
-                                )
-                            )
-                            reduced_tokens -= section_tok - new_tokens
-                except Exception as e:
-                    logging.error(
-                        f"[reduce_context] Error summarizing {section_name}: {e}"
+                # Partial summaries are written for this request at this size,
+                # so they are only reused by the same user's agent asking the
+                # same thing with the same budget
+                model = (
+                    ability_selection_model
+                    if ability_selection_server
+                    else self.agent_name
+                )
+                request_hash = hashlib.sha256(
+                    user_input[:300].encode("utf-8")
+                ).hexdigest()[:16]
+                result = await MapReduceSummarizer(
+                    summarize=summarize_part,
+                    count_tokens=get_tokens,
+                    chunk_size=16000,
+                    cache_namespace=(
+                        f"reduce_context:{self.user_id}:{self.agent.agent_id}:"
+                        f"{model}:{section_name}:{request_hash}:"
+                        f"{target_section_tokens}"
+                    ),
+                ).run(section_text, token_budget=target_section_tokens)
+                return result.summary, target_section_tokens
+
+            def truncate_section(section_name, content, section_tok):
+                nonlocal reduced_tokens
+                if isinstance(content, list) and len(content) > 3:
+                    if section_name in [
+                        "activities",
+                        "conversation",
+                        "conversation_history",
+                    ]:
+                        reduced_context[section_name] = content[-5:]
+                    else:
+                        reduced_context[section_name] = content[:5]
+                    new_tokens = get_tokens(
+                        "\n".join(str(item) for item in reduced_context[section_name])
                     )
-                    # Fall back to simple truncation
-                    if isinstance(content, list) and len(content) > 3:
-                        if section_name in [
-                            "activities",
-                            "conversation",
-                            "conversation_history",
-                        ]:
-                            reduced_context[section_name] = content[-5:]
-                        else:
-                            reduced_context[section_name] = content[:5]
-                        new_tokens = get_tokens(
-                            "\n".join(
-                                str(item) for item in reduced_context[section_name]
-                            )
-                        )
-                        reduced_tokens -= section_tok - new_tokens
+                    reduced_tokens -= section_tok - new_tokens
 
-                # Stop iterating sections if we're under target
+            outcomes = await asyncio.gather(
+                *[
+                    summarize_section(section_name, section_text, section_tok)
+                    for section_name, _, section_text, section_tok in candidates
+                ],
+                return_exceptions=True,
+            )
+            for (section_name, content, section_text, section_tok), outcome in zip(
+                candidates, outcomes
+            ):
+                # Stop applying summaries once we're under target
                 if reduced_tokens <= target_tokens:
                     break
+                if isinstance(outcome, Exception):
+                    logging.error(
+                        f"[reduce_context] Error summarizing {section_name}: {outcome}"
+                    )
+                    # Fall back to simple truncation
+                    truncate_section(section_name, content, section_tok)
+                    continue
+                summary, target_section_tokens = outcome
+                if summary and len(summary) > 50:
+                    new_tokens = get_tokens(summary)
+                    # Quality guard: if the summarizer collapsed the
+                    # section to under 25% of the requested target, the
+                    # output is almost certainly lossy beyond usefulness
+                    # (observed: 17,438 -> 422 tokens, 97.6% loss). Reject
+                    # and fall through to bounded truncation instead so we
+                    # preserve actionable detail (e.g. flux numbers,
+                    # persona-driven analysis rules).
+                    min_acceptable = max(500, int(target_section_tokens * 0.25))
+                    if new_tokens < min_acceptable and section_tok > min_acceptable * 4:
+                        logging.warning(
+                            f"[reduce_context] Rejecting over-aggressive "
+                            f"summary for {section_name}: {section_tok} -> "
+                            f"{new_tokens} tokens (target ~{target_section_tokens}, "
+                            f"min acceptable {min_acceptable}). Falling back "
+                            f"to bounded truncation."
+                        )
+                        # Force the fallback path below
+                        summary = ""
+                        new_tokens = section_tok
+                    saved = section_tok - new_tokens
+                    if summary and saved > 0:
+                        reduced_context[section_name] = summary
+                        reduced_tokens -= saved
+                        logging.info(
+                            f"[reduce_context] Summarized {section_name}: {section_tok} -> {new_tokens} tokens (saved {saved})"
+                        )
+                if not summary or len(summary) <= 50:
+                    # Summarization failed, fall back to truncation
+                    truncate_section(section_name, content, section_tok)
 
         # Step 4: Hard-truncation safety net. If summarization could not bring
         # context under target (e.g. summarizer model failed, returned bloated
@@ -4010,7 +4131,7 @@ Example: If user says "list my files", use:
             async for chunk in iterate_stream(stream):
                 # Check for cancellation periodically during streaming
                 if chunk_count % 10 == 0:  # Check every 10 chunks to avoid overhead
-                    self._check_cancelled()
+                    self._check_cancelled(conversation_id)
 
                 chunk_count += 1
 
@@ -4942,6 +5063,7 @@ Example: If user says "list my files", use:
         # Use has_complete_answer() to properly check for complete answer blocks
         # This handles edge cases like <thinking> inside <answer> tags
         while True:
+            self._check_cancelled(conversation_id)
             _response_has_complete_answer = has_complete_answer(self.response)
             _current_answer_hash = None
             if _response_has_complete_answer:
@@ -7014,7 +7136,7 @@ Return only one top-level <answer>...</answer> block. The opening <answer> tag M
             thinking_id = c.get_thinking_id(agent_name=self.agent_name)
 
         # Check for cancellation before starting command execution
-        self._check_cancelled()
+        self._check_cancelled(conversation_id)
 
         # Extract commands from the response
         commands_to_execute = self.extract_commands_from_response(self.response)
@@ -7034,7 +7156,7 @@ Return only one top-level <answer>...</answer> block. The opening <answer> tag M
             commands_deduplicated_this_call = 0
             for command_block, command_name, command_args in commands_to_execute:
                 # Check for cancellation before each command
-                self._check_cancelled()
+                self._check_cancelled(conversation_id)
 
                 # Save original args before any runtime modifications
                 # This is used for reformatting the response without runtime metadata
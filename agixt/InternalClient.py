@@ -12,6 +12,7 @@ import os
 import logging
 from typing import Dict, List, Any, Optional
 from Globals import getenv
+from InternalInvocation import invoke, invoke_sync
 
 logging.basicConfig(
     level=getenv("LOG_LEVEL"),
@@ -125,21 +126,69 @@ class InternalClient:
         prompt_name: str = "Think About It",
         prompt_args: dict = None,
         parent_activity_id: str = None,
+        timeout: float = None,
     ) -> str:
         """
         Send a prompt to an agent directly without HTTP round-trip.
 
+        Synchronous callers block while the prompt runs on the shared invocation
+        loop. Coroutines should await `prompt_agent_async` instead.
+
         Args:
             agent_id: The agent's UUID (preferred)
             agent_name: The agent's name (fallback)
             prompt_name: Name of the prompt to use
             prompt_args: Arguments to pass to the prompt
             parent_activity_id: Optional ID of parent thinking activity to nest under
+            timeout: Optional deadline in seconds, capped by the parent's deadline
 
         Returns:
             The agent's response as a string
         """
-        import asyncio
+        return invoke_sync(
+            lambda: self._prompt_agent(
+                agent_id=agent_id,
+                agent_name=agent_name,
+                prompt_name=prompt_name,
+                prompt_args=prompt_args,
+                parent_activity_id=parent_activity_id,
+            ),
+            timeout=timeout,
+        )
+
+    async def prompt_agent_async(
+        self,
+        agent_id: str = None,
+        agent_name: str = None,
+        prompt_name: str = "Think About It",
+        prompt_args: dict = None,
+        parent_activity_id: str = None,
+        timeout: float = None,
+    ) -> str:
+        """
+        Async version of `prompt_agent`, run on the caller's event loop.
+
+        Cancelling the calling task cancels the nested prompt.
+        """
+        return await invoke(
+            lambda: self._prompt_agent(
+                agent_id=agent_id,
+                agent_name=agent_name,
+                prompt_name=prompt_name,
+                prompt_args=prompt_args,
+                parent_activity_id=parent_activity_id,
+            ),
+            timeout=timeout,
+        )
+
+    async def _prompt_agent(
+        self,
+        agent_id: str = None,
+        agent_name: str = None,
+        prompt_name: str = "Think About It",
+        prompt_args: dict = None,
+        parent_activity_id: str = None,
+    ) -> str:
         from Models import ChatCompletions
 
         if prompt_args is None:
@@ -197,38 +246,13 @@ class InternalClient:
         messages = [message_data]
 
         # Run the prompt
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        if loop.is_running():
-            # We're already in an async context, create a task
-            import concurrent.futures
-
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(
-                    asyncio.run,
-                    agixt.chat_completions(
-                        prompt=ChatCompletions(
-                            model=agent_name,
-                            user=conversation_name,
-                            messages=messages,
-                        )
-                    ),
-                )
-                response = future.result()
-        else:
-            response = loop.run_until_complete(
-                agixt.chat_completions(
-                    prompt=ChatCompletions(
-                        model=agent_name,
-                        user=conversation_name,
-                        messages=messages,
-                    )
-                )
+        response = await agixt.chat_completions(
+            prompt=ChatCompletions(
+                model=agent_name,
+                user=conversation_name,
+                messages=messages,
             )
+        )
 
         if isinstance(response, dict) and "choices" in response:
             return response["choices"][0]["message"]["content"]
@@ -368,10 +392,54 @@ class InternalClient:
         all_responses: bool = False,
         from_step: int = 1,
         chain_args: dict = None,
+        timeout: float = None,
     ) -> str:
         """Run a chain directly without HTTP round-trip."""
-        import asyncio
+        return invoke_sync(
+            lambda: self._run_chain(
+                chain_name=chain_name,
+                user_input=user_input,
+                agent_id=agent_id,
+                agent_name=agent_name,
+                from_step=from_step,
+                chain_args=chain_args,
+            ),
+            timeout=timeout,
+        )
+
+    async def run_chain_async(
+        self,
+        chain_name: str,
+        user_input: str = "",
+        agent_id: str = None,
+        agent_name: str = None,
+        all_responses: bool = False,
+        from_step: int = 1,
+        chain_args: dict = None,
+        timeout: float = None,
+    ) -> str:
+        """Async version of `run_chain`, run on the caller's event loop."""
+        return await invoke(
+            lambda: self._run_chain(
+                chain_name=chain_name,
+                user_input=user_input,
+                agent_id=agent_id,
+                agent_name=agent_name,
+                from_step=from_step,
+                chain_args=chain_args,
+            ),
+            timeout=timeout,
+        )
 
+    async def _run_chain(
+        self,
+        chain_name: str,
+        user_input: str = "",
+        agent_id: str = None,
+        agent_name: str = None,
+        from_step: int = 1,
+        chain_args: dict = None,
+    ) -> str:
         # Get agent name from ID if needed
         if agent_id and not agent_name:
             agent = self._get_agent(agent_id=agent_id)
@@ -402,39 +470,14 @@ class InternalClient:
         )
 
         # Run the chain
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        if loop.is_running():
-            import concurrent.futures
-
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(
-                    asyncio.run,
-                    agixt.execute_chain(
-                        chain_name=chain_name,
-                        user_input=user_input,
-                        agent_override=agent_name,
-                        from_step=from_step,
-                        chain_args=chain_args,
-                        log_output=log_output,
-                    ),
-                )
-                response = future.result()
-        else:
-            response = loop.run_until_complete(
-                agixt.execute_chain(
-                    chain_name=chain_name,
-                    user_input=user_input,
-                    agent_override=agent_name,
-                    from_step=from_step,
-                    chain_args=chain_args,
-                    log_output=log_output,
-                )
-            )
+        response = await agixt.execute_chain(
+            chain_name=chain_name,
+            user_input=user_input,
+            agent_override=agent_name,
+            from_step=from_step,
+            chain_args=chain_args,
+            log_output=log_output,
+        )
 
         return str(response) if response else ""
 
@@ -496,7 +539,25 @@ class InternalClient:
         self, agent_id: str, url: str, collection_number: str = "0"
     ) -> Dict[str, Any]:
         """Learn from a URL."""
-        import asyncio
+        return invoke_sync(
+            lambda: self._learn_url(
+                agent_id=agent_id, url=url, collection_number=collection_number
+            )
+        )
+
+    async def learn_url_async(
+        self, agent_id: str, url: str, collection_number: str = "0"
+    ) -> Dict[str, Any]:
+        """Async version of `learn_url`, run on the caller's event loop."""
+        return await invoke(
+            lambda: self._learn_url(
+                agent_id=agent_id, url=url, collection_number=collection_number
+            )
+        )
+
+    async def _learn_url(
+        self, agent_id: str, url: str, collection_number: str = "0"
+    ) -> Dict[str, Any]:
         from Memories import Memories
 
         agent = self._get_agent(agent_id=agent_id)
@@ -507,22 +568,7 @@ class InternalClient:
             ApiClient=self,
             user=self.user,
         )
-
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        if loop.is_running():
-            import concurrent.futures
-
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(asyncio.run, memory.read_url(url=url))
-                result = future.result()
-        else:
-            result = loop.run_until_complete(memory.read_url(url=url))
-
+        await memory.read_url(url=url)
         return {"message": f"URL {url} learned successfully"}
 
     # ========== Prompt Methods ==========
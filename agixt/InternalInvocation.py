@@ -0,0 +1,284 @@
+"""
+Internal invocation layer for nested agent calls.
+
+Agents call other agents (and chains) through InternalClient. Those calls used to
+spin up a fresh thread and event loop per call whenever a loop was already
+running, blocking the caller and breaking loop-bound resources such as pooled
+HTTP/MCP sessions. This module gives nested calls:
+
+- an async path (`invoke`) awaited directly from coroutines, so cancellation of
+  the parent task reaches the child naturally;
+- a single long-lived background loop (`invoke_sync`) for genuinely synchronous
+  callers, instead of a new loop per call;
+- a concurrency limit per nesting depth, so fan-out is bounded without a parent
+  holding a slot ever starving its own children;
+- deadlines and stop checks inherited from the parent interaction through
+  context variables.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Concurrent nested calls allowed at each nesting depth, per event loop
+MAX_CONCURRENT_NESTED_CALLS = int(os.getenv("MAX_CONCURRENT_NESTED_AGENT_CALLS", "8"))
+
+# Agent-to-agent recursion deeper than this is almost certainly a loop
+MAX_NESTING_DEPTH = int(os.getenv("MAX_AGENT_NESTING_DEPTH", "8"))
+
+# How often blocked sync callers check whether the parent was stopped
+CANCEL_POLL_INTERVAL = 0.1
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "agixt_invocation_deadline", default=None
+)
+_depth: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "agixt_invocation_depth", default=0
+)
+_cancel_checks: contextvars.ContextVar[Tuple[Callable[[], bool], ...]] = (
+    contextvars.ContextVar("agixt_invocation_cancel_checks", default=())
+)
+
+
+class InvocationTimeout(asyncio.TimeoutError):
+    """A nested call ran past its own or its parent's deadline"""
+
+
+class InvocationDepthExceeded(RuntimeError):
+    """Nested agent calls went deeper than MAX_NESTING_DEPTH"""
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current interaction's deadline, if it has one"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def current_depth() -> int:
+    return _depth.get()
+
+
+def is_cancelled() -> bool:
+    """Whether any enclosing interaction has been stopped"""
+    for check in _cancel_checks.get():
+        try:
+            if check():
+                return True
+        except Exception as e:
+            logger.debug(f"Invocation cancel check failed: {e}")
+    return False
+
+
+def _effective_deadline(timeout: Optional[float]) -> Optional[float]:
+    deadline = _deadline.get()
+    if timeout is not None and timeout > 0:
+        own = time.monotonic() + timeout
+        deadline = own if deadline is None else min(deadline, own)
+    return deadline
+
+
+@contextmanager
+def invocation_scope(
+    timeout: Optional[float] = None,
+    cancel_check: Optional[Callable[[], bool]] = None,
+):
+    """
+    Set a deadline and/or stop check for everything invoked inside the block.
+
+    Scopes nest: a child can only shorten its parent's deadline, and every
+    enclosing stop check still applies.
+    """
+    deadline_token = _deadline.set(_effective_deadline(timeout))
+    checks_token = None
+    if cancel_check is not None:
+        checks_token = _cancel_checks.set(_cancel_checks.get() + (cancel_check,))
+    try:
+        yield
+    finally:
+        if checks_token is not None:
+            _cancel_checks.reset(checks_token)
+        _deadline.reset(deadline_token)
+
+
+class _ConcurrencyLimiter:
+    """asyncio semaphores keyed by event loop and nesting depth"""
+
+    def __init__(self):
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, depth: int) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            per_loop = self._semaphores.setdefault(loop, {})
+            if depth not in per_loop:
+                per_loop[depth] = asyncio.Semaphore(MAX_CONCURRENT_NESTED_CALLS)
+            return per_loop[depth]
+
+
+_limiter = _ConcurrencyLimiter()
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0,
+    "sync_calls": 0,
+    "active": 0,
+    "peak_active": 0,
+    "timeouts": 0,
+    "cancelled": 0,
+}
+
+
+def _count(key: str, delta: int = 1):
+    with _stats_lock:
+        _stats[key] += delta
+        if key == "active":
+            _stats["peak_active"] = max(_stats["peak_active"], _stats["active"])
+
+
+async def invoke(
+    coro_factory: Callable[[], Awaitable[T]], timeout: Optional[float] = None
+) -> T:
+    """
+    Run a nested agent call from async code.
+
+    `coro_factory` is only called once a concurrency slot is free, so queued
+    calls do not start work early. The call inherits the parent's deadline and
+    stop checks; waiting for a slot counts against the deadline.
+    """
+    depth = _depth.get()
+    if depth >= MAX_NESTING_DEPTH:
+        raise InvocationDepthExceeded(
+            f"Nested agent calls exceeded the maximum depth of {MAX_NESTING_DEPTH}"
+        )
+    if is_cancelled():
+        _count("cancelled")
+        raise asyncio.CancelledError("Parent interaction was stopped")
+    deadline = _effective_deadline(timeout)
+    _count("calls")
+
+    async def run():
+        deadline_token = _deadline.set(deadline)
+        depth_token = _depth.set(depth + 1)
+        try:
+            async with _limiter.get(depth):
+                _count("active")
+                try:
+                    return await coro_factory()
+                finally:
+                    _count("active", -1)
+        finally:
+            _depth.reset(depth_token)
+            _deadline.reset(deadline_token)
+
+    if deadline is None:
+        return await run()
+    try:
+        return await asyncio.wait_for(run(), max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError as e:
+        # Timeouts raised by the call itself are not ours to relabel
+        if isinstance(e, InvocationTimeout) or time.monotonic() < deadline:
+            raise
+        _count("timeouts")
+        raise InvocationTimeout("Nested agent call exceeded its deadline") from None
+
+
+class _LoopBridge:
+    """One daemon thread running an event loop for synchronous callers"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _run(self, loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._loop, ready),
+                    name="agixt-invocation-loop",
+                    daemon=True,
+                )
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    def in_bridge_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+_bridge = _LoopBridge()
+
+
+def invoke_sync(
+    coro_factory: Callable[[], Awaitable[T]], timeout: Optional[float] = None
+) -> T:
+    """
+    Run a nested agent call from synchronous code.
+
+    The call is scheduled on the shared background loop while this thread waits.
+    The parent's deadline, depth and stop checks carry over. If the parent is
+    stopped while waiting, the child is cancelled and CancelledError is raised
+    here.
+    """
+    _count("sync_calls")
+    context = contextvars.copy_context()
+
+    async def in_parent_context():
+        return await context.run(asyncio.ensure_future, invoke(coro_factory, timeout))
+
+    if _bridge.in_bridge_thread():
+        # Sync code already running on the bridge loop cannot block it to wait
+        # for its own child, so this rare case gets a private loop.
+        logger.debug("Nested sync invocation on the bridge loop, using a new loop")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, in_parent_context()).result()
+
+    future = asyncio.run_coroutine_threadsafe(in_parent_context(), _bridge.get_loop())
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL)
+        except concurrent.futures.TimeoutError:
+            # InvocationTimeout is also a TimeoutError; only keep polling
+            # while the call is genuinely still running
+            if future.done():
+                raise
+            if is_cancelled():
+                future.cancel()
+                _count("cancelled")
+                raise asyncio.CancelledError("Parent interaction was stopped")
+        except concurrent.futures.CancelledError:
+            raise asyncio.CancelledError("Nested agent call was cancelled")
+
+
+def get_invocation_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bridge_running"] = _bridge.running
+    stats["max_concurrent"] = MAX_CONCURRENT_NESTED_CALLS
+    stats["max_depth"] = MAX_NESTING_DEPTH
+    return stats
@@ -14,6 +14,7 @@ from DB import (
     TokenBlacklist,
     PaymentTransaction,
     CompanyTokenUsage,
+    UsageRollup,
     ExtensionCategory,
     Scope,
     CustomRole,
@@ -46,7 +47,7 @@ from Models import (
     UserResponse,
 )
 from typing import List, Optional
-from fastapi import Header, HTTPException
+from fastapi import Header, HTTPException, Request
 from Globals import getenv, get_default_agent
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from datetime import datetime, timedelta, timezone
@@ -56,7 +57,6 @@ from middleware import log_silenced_exception
 import ast
 import importlib
 import pyotp
-import argon2
 import logging
 import traceback
 import requests
@@ -72,6 +72,20 @@ from ExtensionsHub import (
     get_extension_class_name,
 )
 from SharedCache import shared_cache
+from CredentialService import credential_service
+from BillingAnalytics import record_usage
+from Entitlements import PRICING_TIERED, entitlements
+from AuthContext import (
+    SOURCE_API_KEY,
+    SOURCE_PAT,
+    AuthContext,
+    auth_context_resolver,
+    deserialize_user,
+    get_auth_context,
+    get_request_auth_context,
+    scope_matches,
+    serialize_user,
+)
 
 import time as _time
 
@@ -171,6 +185,10 @@ def _get_cached_pricing_config():
     return _cached_pricing_config
 
 
+# Keep cached entitlements in step with billing writes made through the ORM
+entitlements.watch(Company, UserCompany)
+
+
 def hash_pat_token(token: str) -> str:
     """
     Securely hash a Personal Access Token using PBKDF2-HMAC-SHA256.
@@ -198,34 +216,8 @@ def hash_pat_token(token: str) -> str:
     return dk.hex()
 
 
-def _serialize_user_dict(user_dict: dict) -> dict:
-    """Convert user dict to JSON-serializable format (handles datetime fields)."""
-    from datetime import datetime
-
-    result = {}
-    for key, value in user_dict.items():
-        if isinstance(value, datetime):
-            result[key] = value.isoformat()
-        else:
-            result[key] = value
-    return result
-
-
-def _deserialize_user_dict(cached_dict: dict) -> dict:
-    """Convert cached user dict back from JSON format (handles datetime fields)."""
-    from datetime import datetime
-
-    result = {}
-    datetime_fields = {"created_at", "updated_at", "tos_accepted_at"}
-    for key, value in cached_dict.items():
-        if key in datetime_fields and value is not None and isinstance(value, str):
-            try:
-                result[key] = datetime.fromisoformat(value)
-            except ValueError:
-                result[key] = value
-        else:
-            result[key] = value
-    return result
+_serialize_user_dict = serialize_user
+_deserialize_user_dict = deserialize_user
 
 
 def get_token_validation_cached(token: str):
@@ -259,6 +251,7 @@ def invalidate_token_validation_cache(token: str = None):
     else:
         token_hash = hashlib.sha256(token.encode()).hexdigest()
         shared_cache.delete(f"token_validation:{token_hash}")
+    auth_context_resolver.invalidate(token=token)
 
 
 def get_user_id_cached(email: str):
@@ -287,6 +280,7 @@ def invalidate_user_company_cache(user_id: str = None):
         shared_cache.delete_pattern("user_company:*")
     else:
         shared_cache.delete(f"user_company:{user_id}")
+    auth_context_resolver.invalidate(user_id=user_id)
 
 
 # User scopes cache TTL - 60 seconds (short enough to catch role changes quickly)
@@ -326,6 +320,93 @@ def invalidate_user_scopes_cache(user_id: str = None, company_id: str = None):
         shared_cache.delete_pattern(f"user_scopes:*:{company_id}")
     else:
         shared_cache.delete(f"user_scopes:{user_id}:{company_id}")
+    # Cached auth contexts carry scopes too
+    auth_context_resolver.invalidate(user_id=user_id)
+
+
+def query_user_scopes(db, user_id: str, company_id: str, role_id: int) -> set:
+    """
+    Scopes granted by a role and the user's custom roles in a company.
+    Wildcard patterns from default_role_scopes are included as is, with
+    ext:* also expanded to the extensions configured for the company.
+    Callers handle super admins (role 0) themselves.
+    """
+    from DB import default_role_scopes as db_default_role_scopes
+
+    scopes = set()
+
+    # Get scopes from default role (expanded individual scopes)
+    default_role_scopes_db = (
+        db.query(Scope)
+        .join(DefaultRoleScope, DefaultRoleScope.scope_id == Scope.id)
+        .filter(DefaultRoleScope.role_id == role_id)
+        .all()
+    )
+    scopes.update(s.name for s in default_role_scopes_db)
+
+    # Handle wildcard patterns from default_role_scopes definition
+    # Include wildcard patterns directly so frontend can perform proper scope checking
+    if role_id in db_default_role_scopes:
+        has_ext_wildcard = "ext:*" in db_default_role_scopes[role_id]
+
+        for pattern in db_default_role_scopes[role_id]:
+            # Include wildcard patterns (*, ext:*, etc.) so frontend can check them
+            if pattern.endswith(":*") or ":*:" in pattern or pattern == "*":
+                scopes.add(pattern)
+
+        # If role has ext:* wildcard, also expand to specific extensions configured for this company
+        # This provides both the wildcard for frontend matching AND specific scopes for backend checks
+        if has_ext_wildcard:
+            # Get extension names that are configured for this company
+            # (via CompanyExtensionCommand or CompanyExtensionSetting)
+            configured_extensions = set()
+
+            # Get from CompanyExtensionCommand
+            ext_commands = (
+                db.query(CompanyExtensionCommand.extension_name)
+                .filter(CompanyExtensionCommand.company_id == company_id)
+                .distinct()
+                .all()
+            )
+            configured_extensions.update(ec[0] for ec in ext_commands)
+
+            # Get from CompanyExtensionSetting
+            ext_settings = (
+                db.query(CompanyExtensionSetting.extension_name)
+                .filter(CompanyExtensionSetting.company_id == company_id)
+                .distinct()
+                .all()
+            )
+            configured_extensions.update(es[0] for es in ext_settings)
+
+            # Add ext scopes only for configured extensions
+            if configured_extensions:
+                # Get all ext:* scopes from DB that match configured extensions
+                ext_scopes = db.query(Scope).filter(Scope.name.like("ext:%")).all()
+                for scope in ext_scopes:
+                    # Parse the scope name to get extension name
+                    # Format: ext:extension_name:... or ext:extension_name:feature:action
+                    parts = scope.name.split(":")
+                    if len(parts) >= 2:
+                        ext_name = parts[1]
+                        if ext_name in configured_extensions:
+                            scopes.add(scope.name)
+
+    # Get scopes from custom roles assigned to this user in this company
+    custom_role_scopes = (
+        db.query(Scope)
+        .join(CustomRoleScope, CustomRoleScope.scope_id == Scope.id)
+        .join(CustomRole, CustomRole.id == CustomRoleScope.custom_role_id)
+        .join(UserCustomRole, UserCustomRole.custom_role_id == CustomRole.id)
+        .filter(
+            UserCustomRole.user_id == user_id,
+            UserCustomRole.company_id == company_id,
+            CustomRole.is_active == True,
+        )
+        .all()
+    )
+    scopes.update(s.name for s in custom_role_scopes)
+    return scopes
 
 
 def promote_superadmin_if_needed(session, user_id: str, email: str, company_id: str):
@@ -1112,75 +1193,21 @@ def get_admin_user():
         session.close()
 
 
-def verify_api_key(authorization: str = Header(None)):
+def verify_api_key(authorization: str = Header(None), request: Request = None):
+    """
+    Return the user dict for a JWT or personal access token.
+
+    Inside a request the AuthContext is shared with require_scope and
+    get_auth_context, so the token is decoded and the user loaded only once.
+    """
     AGIXT_API_KEY = os.getenv("AGIXT_API_KEY", "")
-    authorization = str(authorization).replace("Bearer ", "").replace("bearer ", "")
     if AGIXT_API_KEY:
         try:
-
-            # Check if this is a Personal Access Token (starts with "agixt_")
-            if authorization.startswith("agixt_"):
-                pat_validation = validate_personal_access_token(authorization)
-                if not pat_validation["valid"]:
-                    raise HTTPException(
-                        status_code=401,
-                        detail=pat_validation.get(
-                            "error", "Invalid personal access token"
-                        ),
-                    )
-                # Return user info from PAT validation
-                db = get_session()
-                user = (
-                    db.query(User).filter(User.id == pat_validation["user_id"]).first()
-                )
-                if not user:
-                    db.close()
-                    raise HTTPException(
-                        status_code=401, detail="User not found for token"
-                    )
-                user_dict = user.__dict__.copy()
-                user_dict.pop("_sa_instance_state", None)
-                # Add PAT-specific info to the user dict for downstream use
-                user_dict["_pat_scopes"] = pat_validation.get("scopes", [])
-                user_dict["_pat_agent_ids"] = pat_validation.get("agent_ids", [])
-                user_dict["_pat_company_ids"] = pat_validation.get("company_ids", [])
-                db.close()
-                return user_dict
-
-            # Check cache first for JWT tokens (short TTL for security)
-            cached_user = get_token_validation_cached(authorization)
-            if cached_user is not None:
-                return cached_user
-
-            # Check if token is blacklisted before validating
-            db = get_session()
-            try:
-                blacklisted_token = (
-                    db.query(TokenBlacklist)
-                    .filter(TokenBlacklist.token == authorization)
-                    .first()
-                )
-                if blacklisted_token:
-                    raise HTTPException(
-                        status_code=401,
-                        detail="Token has been revoked. Please log in again.",
-                    )
-
-                token = jwt.decode(
-                    jwt=authorization,
-                    key=AGIXT_API_KEY,
-                    algorithms=["HS256"],
-                    leeway=timedelta(hours=5),
-                )
-                user = db.query(User).filter(User.id == token["sub"]).first()
-                # return user dict
-                user_dict = user.__dict__
-                user_dict.pop("_sa_instance_state")
-                # Cache the validation result for a short time
-                set_token_validation_cache(authorization, user_dict.copy())
-                return user_dict
-            finally:
-                db.close()
+            context = get_request_auth_context(request, authorization)
+            # The raw API key is only accepted through MagicalAuth
+            if context.source == SOURCE_API_KEY:
+                raise HTTPException(status_code=401, detail="Invalid API Key")
+            return context.user_dict()
         except Exception as e:
             logging.info(f"Error verifying API Key: {str(e)}")
             raise HTTPException(status_code=401, detail="Invalid API Key")
@@ -1191,6 +1218,59 @@ def verify_api_key(authorization: str = Header(None)):
         raise HTTPException(status_code=401, detail="API Key is missing.")
 
 
+def load_auth_context(token: str, source: str, identity: dict) -> AuthContext:
+    """
+    Load the user, their company, super admin status and scopes in one
+    session. Used by AuthContextResolver on a cache miss.
+    """
+    user_id = str(identity["user_id"])
+    session = get_session()
+    try:
+        user = session.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found for token")
+        user_dict = user.__dict__.copy()
+        user_dict.pop("_sa_instance_state", None)
+        memberships = (
+            session.query(UserCompany).filter(UserCompany.user_id == user_id).all()
+        )
+        company_id = None
+        role_id = None
+        # The first membership is the user's current company, as in get_user_company_id
+        if memberships and memberships[0].company_id is not None:
+            company_id_str = str(memberships[0].company_id)
+            if company_id_str.lower() not in ["none", "null", ""]:
+                company_id = company_id_str
+                role_id = memberships[0].role_id
+        set_user_company_cache(user_id, company_id or "__NONE__")
+        is_super_admin = any(membership.role_id == 0 for membership in memberships)
+        scopes = set()
+        if source != SOURCE_PAT and not is_super_admin and company_id:
+            cached_scopes = get_user_scopes_cached(user_id, company_id)
+            if cached_scopes is not None:
+                scopes = cached_scopes
+            else:
+                scopes = query_user_scopes(session, user_id, company_id, role_id)
+                set_user_scopes_cache(user_id, company_id, scopes)
+    finally:
+        session.close()
+    context = AuthContext(
+        token=token,
+        source=source,
+        user=user_dict,
+        user_id=user_id,
+        email=user_dict.get("email") or identity.get("email"),
+        company_id=company_id,
+        is_super_admin=is_super_admin,
+        scopes=scopes,
+    )
+    if source == SOURCE_PAT:
+        context.pat_scopes = set(identity.get("scopes", []))
+        context.pat_agent_ids = set(identity.get("agent_ids", []))
+        context.pat_company_ids = set(identity.get("company_ids", []))
+    return context
+
+
 def require_scope(*required_scopes):
     """
     FastAPI dependency factory to require specific scopes.
@@ -1201,30 +1281,30 @@ def require_scope(*required_scopes):
                           If multiple are provided, user needs at least one.
 
     Returns:
-        A dependency function that validates scope access.
+        A dependency function that validates scope access and returns the
+        request's AuthContext.
     """
 
-    def scope_checker(authorization: str = Header(None)):
+    async def scope_checker(request: Request, authorization: str = Header(None)):
         if not authorization:
             raise HTTPException(status_code=401, detail="Authorization required")
 
-        token = str(authorization).replace("Bearer ", "").replace("bearer ", "")
-        auth = MagicalAuth(token=token)
+        context = await get_auth_context(request, authorization)
 
         if len(required_scopes) == 1:
-            if not auth.has_scope(required_scopes[0]):
+            if not context.has_scope(required_scopes[0]):
                 raise HTTPException(
                     status_code=403,
                     detail=f"Insufficient permissions. Required scope: {required_scopes[0]}",
                 )
         else:
-            if not auth.has_any_scope(list(required_scopes)):
+            if not context.has_any_scope(required_scopes):
                 raise HTTPException(
                     status_code=403,
                     detail=f"Insufficient permissions. Required one of: {', '.join(required_scopes)}",
                 )
 
-        return auth
+        return context
 
     return scope_checker
 
@@ -1238,23 +1318,23 @@ def require_all_scopes(*required_scopes):
         *required_scopes: Scope names that are ALL required.
 
     Returns:
-        A dependency function that validates scope access.
+        A dependency function that validates scope access and returns the
+        request's AuthContext.
     """
 
-    def scope_checker(authorization: str = Header(None)):
+    async def scope_checker(request: Request, authorization: str = Header(None)):
         if not authorization:
             raise HTTPException(status_code=401, detail="Authorization required")
 
-        token = str(authorization).replace("Bearer ", "").replace("bearer ", "")
-        auth = MagicalAuth(token=token)
+        context = await get_auth_context(request, authorization)
 
-        if not auth.has_all_scopes(list(required_scopes)):
+        if not context.has_all_scopes(required_scopes):
             raise HTTPException(
                 status_code=403,
                 detail=f"Insufficient permissions. Required all of: {', '.join(required_scopes)}",
             )
 
-        return auth
+        return context
 
     return scope_checker
 
@@ -1717,21 +1797,19 @@ class MagicalAuth:
 
         Argon2id is the recommended password hashing algorithm, combining
         Argon2i (side-channel resistance) and Argon2d (GPU cracking resistance).
+        The hash runs in CredentialService's bounded process pool; call this
+        from a worker thread, not the event loop.
 
         Args:
             password: The plaintext password to hash
 
         Returns:
             The hashed password string (includes salt and parameters)
+
+        Raises:
+            HTTPException: 429 if the hashing pool is saturated
         """
-        ph = argon2.PasswordHasher(
-            time_cost=2,  # Number of iterations
-            memory_cost=65536,  # Memory usage in KB (64 MB)
-            parallelism=1,  # Number of parallel threads
-            hash_len=32,  # Length of the hash in bytes
-            salt_len=16,  # Length of the random salt
-        )
-        return ph.hash(password)
+        return credential_service.hash_sync(password)
 
     @staticmethod
     def verify_password(password: str, password_hash: str) -> bool:
@@ -1744,18 +1822,11 @@ class MagicalAuth:
 
         Returns:
             True if the password matches, False otherwise
+
+        Raises:
+            HTTPException: 429 if the hashing pool is saturated
         """
-        if not password_hash:
-            return False
-        ph = argon2.PasswordHasher()
-        try:
-            ph.verify(password_hash, password)
-            return True
-        except argon2.exceptions.VerifyMismatchError:
-            return False
-        except (argon2.exceptions.InvalidHash, argon2.exceptions.VerificationError):
-            logging.error("Password verification error: invalid hash format")
-            return False
+        return credential_service.verify_sync(password, password_hash)[0]
 
     def generate_jwt(self, user_id: str, email: str, admin: bool = False) -> str:
         """
@@ -1864,7 +1935,10 @@ class MagicalAuth:
                 }
 
             # Verify password
-            if not self.verify_password(password, user.password_hash):
+            matches, needs_rehash = credential_service.verify_sync(
+                password, user.password_hash
+            )
+            if not matches:
                 # Log failed attempt
                 failed_login = FailedLogins(
                     user_id=user.id,
@@ -1928,6 +2002,16 @@ class MagicalAuth:
                             "status_code": 403,
                         }
 
+            if needs_rehash:
+                # Hashed with older Argon2 parameters; upgrade it now. The
+                # login already succeeded, so a busy pool must not fail it
+                try:
+                    user.password_hash = credential_service.hash_sync(password)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    logging.warning(f"Could not rehash password for {user.id}: {e}")
+
             # Generate JWT token
             token = self.generate_jwt(
                 user_id=str(user.id),
@@ -2641,8 +2725,6 @@ class MagicalAuth:
         Returns:
             set: A set of scope names the user has access to.
         """
-        from DB import default_role_scopes as db_default_role_scopes
-
         if self.user_id is None:
             return set()
 
@@ -2682,79 +2764,7 @@ class MagicalAuth:
                 all_scopes = db.query(Scope).all()
                 return {s.name for s in all_scopes}
 
-            # Get scopes from default role (expanded individual scopes)
-            default_role_scopes_db = (
-                db.query(Scope)
-                .join(DefaultRoleScope, DefaultRoleScope.scope_id == Scope.id)
-                .filter(DefaultRoleScope.role_id == role_id)
-                .all()
-            )
-            scopes.update(s.name for s in default_role_scopes_db)
-
-            # Handle wildcard patterns from default_role_scopes definition
-            # Include wildcard patterns directly so frontend can perform proper scope checking
-            if role_id in db_default_role_scopes:
-                has_ext_wildcard = "ext:*" in db_default_role_scopes[role_id]
-
-                for pattern in db_default_role_scopes[role_id]:
-                    # Include wildcard patterns (*, ext:*, etc.) so frontend can check them
-                    if pattern.endswith(":*") or ":*:" in pattern or pattern == "*":
-                        scopes.add(pattern)
-
-                # If role has ext:* wildcard, also expand to specific extensions configured for this company
-                # This provides both the wildcard for frontend matching AND specific scopes for backend checks
-                if has_ext_wildcard:
-                    # Get extension names that are configured for this company
-                    # (via CompanyExtensionCommand or CompanyExtensionSetting)
-                    configured_extensions = set()
-
-                    # Get from CompanyExtensionCommand
-                    ext_commands = (
-                        db.query(CompanyExtensionCommand.extension_name)
-                        .filter(CompanyExtensionCommand.company_id == company_id)
-                        .distinct()
-                        .all()
-                    )
-                    configured_extensions.update(ec[0] for ec in ext_commands)
-
-                    # Get from CompanyExtensionSetting
-                    ext_settings = (
-                        db.query(CompanyExtensionSetting.extension_name)
-                        .filter(CompanyExtensionSetting.company_id == company_id)
-                        .distinct()
-                        .all()
-                    )
-                    configured_extensions.update(es[0] for es in ext_settings)
-
-                    # Add ext scopes only for configured extensions
-                    if configured_extensions:
-                        # Get all ext:* scopes from DB that match configured extensions
-                        ext_scopes = (
-                            db.query(Scope).filter(Scope.name.like("ext:%")).all()
-                        )
-                        for scope in ext_scopes:
-                            # Parse the scope name to get extension name
-                            # Format: ext:extension_name:... or ext:extension_name:feature:action
-                            parts = scope.name.split(":")
-                            if len(parts) >= 2:
-                                ext_name = parts[1]
-                                if ext_name in configured_extensions:
-                                    scopes.add(scope.name)
-
-            # Get scopes from custom roles assigned to this user in this company
-            custom_role_scopes = (
-                db.query(Scope)
-                .join(CustomRoleScope, CustomRoleScope.scope_id == Scope.id)
-                .join(CustomRole, CustomRole.id == CustomRoleScope.custom_role_id)
-                .join(UserCustomRole, UserCustomRole.custom_role_id == CustomRole.id)
-                .filter(
-                    UserCustomRole.user_id == self.user_id,
-                    UserCustomRole.company_id == company_id,
-                    CustomRole.is_active == True,
-                )
-                .all()
-            )
-            scopes.update(s.name for s in custom_role_scopes)
+            scopes = query_user_scopes(db, self.user_id, company_id, role_id)
 
         # Cache the computed scopes for future calls
         set_user_scopes_cache(self.user_id, company_id, scopes)
@@ -2763,50 +2773,7 @@ class MagicalAuth:
     @staticmethod
     def _scope_matches(scope: str, user_scopes: set) -> bool:
         """Return True when a scope is granted by exact or wildcard match."""
-        if "*" in user_scopes:
-            return True
-
-        if scope in user_scopes:
-            return True
-
-        parts = scope.split(":")
-        if parts[0] == "ext" and len(parts) >= 3:
-            ext_name = parts[1]
-
-            if "ext:*" in user_scopes:
-                return True
-
-            if len(parts) == 3:
-                action = parts[2]
-                if f"ext:*:{action}" in user_scopes:
-                    return True
-                if f"ext:{ext_name}:*" in user_scopes:
-                    return True
-
-            elif len(parts) == 4:
-                feature = parts[2]
-                action = parts[3]
-                if f"ext:*:{feature}:{action}" in user_scopes:
-                    return True
-                if f"ext:*:*:{action}" in user_scopes:
-                    return True
-                if f"ext:{ext_name}:*" in user_scopes:
-                    return True
-                if f"ext:{ext_name}:{feature}:*" in user_scopes:
-                    return True
-                if f"ext:{ext_name}:*:{action}" in user_scopes:
-                    return True
-                if action == "execute" and f"ext:{ext_name}:execute" in user_scopes:
-                    return True
-                if action == "read" and f"ext:{ext_name}:read" in user_scopes:
-                    return True
-
-        if len(parts) >= 2:
-            resource = parts[0]
-            if f"{resource}:*" in user_scopes:
-                return True
-
-        return False
+        return scope_matches(scope, user_scopes)
 
     def has_scope(self, scope: str, company_id: str = None) -> bool:
         """
@@ -4110,6 +4077,9 @@ class MagicalAuth:
     def check_user_limit(self, company_id: str) -> bool:
         """Check if a company can add more users based on billing model.
 
+        Answered from the cached entitlement of the billing company, except for
+        the per_user and per_location counts.
+
         For tiered_plan billing: checks user count against plan tier user limit + addons
         For per_bed billing: no user limit (users are unlimited, billing is per bed)
         For per_user (legacy): checks current user count < user_limit
@@ -4136,6 +4106,14 @@ class MagicalAuth:
         if not billing_enabled:
             return True
 
+        entitlement = entitlements.billing_entitlement(company_id)
+        if entitlement is None:
+            raise HTTPException(status_code=404, detail="Company not found")
+        can_add = entitlement.can_add_user(pricing_model)
+        if can_add is not None:
+            return can_add
+
+        # Seat models that count members or locations
         session = get_session()
         try:
             company, billing_company, session, _ = self._get_billing_company(
@@ -4253,34 +4231,10 @@ class MagicalAuth:
                 "message": "No device limits",
             }
 
-        session = get_session()
-        try:
-            _, billing_company, session, _ = self._get_billing_company(
-                company_id, session=session
-            )
-            plan_id = billing_company.plan_id
-            tier = self._get_plan_tier(plan_id, pricing_config)
-            limits = tier.get("limits", {})
-
-            device_limit = (limits.get("devices") or 0) + (
-                billing_company.addon_devices or 0
-            )
-            device_count = billing_company.device_count or 0
-
-            can_add = device_count < device_limit if device_limit else True
-
-            return {
-                "can_add": can_add,
-                "current": device_count,
-                "limit": device_limit,
-                "message": (
-                    f"Device limit reached ({device_count}/{device_limit}). Upgrade your plan to add more devices."
-                    if not can_add
-                    else f"{device_count}/{device_limit} devices used"
-                ),
-            }
-        finally:
-            session.close()
+        entitlement = entitlements.billing_entitlement(company_id)
+        if entitlement is None:
+            raise HTTPException(status_code=404, detail="Company not found")
+        return entitlement.device_check()
 
     def check_storage_limit(self, company_id: str, additional_bytes: int = 0) -> dict:
         """Check if a company can use more storage.
@@ -4304,41 +4258,10 @@ class MagicalAuth:
                 "message": "No storage limits",
             }
 
-        session = get_session()
-        try:
-            _, billing_company, session, _ = self._get_billing_company(
-                company_id, session=session
-            )
-            plan_id = billing_company.plan_id
-            tier = self._get_plan_tier(plan_id, pricing_config)
-            limits = tier.get("limits", {})
-
-            storage_limit_gb = limits.get("storage_gb") or 0
-            storage_limit_bytes = storage_limit_gb * 1024 * 1024 * 1024 + (
-                billing_company.addon_storage_bytes or 0
-            )
-            storage_used = billing_company.storage_used_bytes or 0
-
-            can_add = (
-                (storage_used + additional_bytes) <= storage_limit_bytes
-                if storage_limit_bytes
-                else True
-            )
-
-            return {
-                "can_add": can_add,
-                "used_bytes": storage_used,
-                "limit_bytes": storage_limit_bytes,
-                "used_gb": round(storage_used / (1024 * 1024 * 1024), 2),
-                "limit_gb": round(storage_limit_bytes / (1024 * 1024 * 1024), 2),
-                "message": (
-                    "Storage limit reached. Upgrade your plan or use your own S3 storage."
-                    if not can_add
-                    else f"{round(storage_used / (1024 * 1024 * 1024), 2)}GB / {round(storage_limit_bytes / (1024 * 1024 * 1024), 2)}GB used"
-                ),
-            }
-        finally:
-            session.close()
+        entitlement = entitlements.billing_entitlement(company_id)
+        if entitlement is None:
+            raise HTTPException(status_code=404, detail="Company not found")
+        return entitlement.storage_check(additional_bytes)
 
     def increment_device_count(self, company_id: str, count: int = 1) -> dict:
         """Increment the device count for a company, checking limits atomically.
@@ -4699,16 +4622,20 @@ class MagicalAuth:
         Raises HTTPException 402 if billing is enabled and balance is insufficient.
         Should be called before any billable operation (inference, etc).
         Super admins (role 0) are exempt from billing checks.
+        Answered from cached entitlements; a refusal is confirmed against the
+        database first.
         """
         # Check if billing is enabled
-        price_service = _get_price_service()
-        token_price = price_service.get_token_price()
+        token_price = entitlements.token_price()
         billing_enabled = token_price > 0
 
         if not billing_enabled:
             # Billing is disabled, allow all operations
             return True
 
+        if entitlements.has_billing_access(self.user_id):
+            return True
+
         # Get wallet address for the 402 response
         wallet_address = getenv("PAYMENT_WALLET_ADDRESS", "")
 
@@ -4723,12 +4650,13 @@ class MagicalAuth:
 
             # Super admins (role 0) are exempt from paywall
             is_super_admin = any(uc.role_id == 0 for uc in user_companies)
-            if is_super_admin:
-                return True
-
-            # Check if any company has sufficient balance
-            if self._has_sufficient_token_balance(session, user_companies):
+            if is_super_admin or self._has_sufficient_token_balance(
+                session, user_companies
+            ):
+                # The cached entitlements were stale
+                entitlements.forget_user(self.user_id)
                 return True
+            entitlements.record_refusal()
 
             # No sufficient balance found - raise 402
             raise HTTPException(
@@ -6473,22 +6401,17 @@ class MagicalAuth:
             if close_session:
                 session.close()
 
-    def increase_token_counts(self, input_tokens: int = 0, output_tokens: int = 0):
+    def increase_token_counts(
+        self, input_tokens: int = 0, output_tokens: int = 0, agent_id=None
+    ):
         self.validate_user()
         session = get_session()
         total_tokens = input_tokens + output_tokens
+        audit_company_id = None
 
         try:
-            # Check if billing is enabled
-            price_service = _get_price_service()
-            token_price = price_service.get_token_price()
-            billing_enabled = token_price > 0
-
-            # Get pricing model
-            pricing_config = _get_cached_pricing_config()
-            pricing_model = (
-                pricing_config.get("pricing_model") if pricing_config else "per_token"
-            )
+            billing_enabled = entitlements.billing_enabled()
+            pricing_model = entitlements.pricing_model()
 
             # Get user's company
             user_company = (
@@ -6497,113 +6420,44 @@ class MagicalAuth:
                 .first()
             )
 
-            if user_company and (billing_enabled or pricing_model == "tiered_plan"):
-                user_direct_company = (
-                    session.query(Company)
-                    .filter(Company.id == user_company.company_id)
-                    .first()
+            if user_company and (billing_enabled or pricing_model == PRICING_TIERED):
+                # Charged to the root parent company in one conditional UPDATE:
+                # tiered plans roll the period over and take only the overage
+                # from the balance, other models refuse to overdraw (402)
+                charged = entitlements.charge(
+                    session,
+                    str(user_company.company_id),
+                    total_tokens,
+                    billing_enabled=billing_enabled,
                 )
-
-                if user_direct_company:
-                    # Get the root parent company for billing purposes
-                    root_company_id = self.get_root_parent_company(
-                        str(user_direct_company.id), session=session
-                    )
-
-                    if str(root_company_id) != str(user_direct_company.id):
-                        billing_company = (
-                            session.query(Company)
-                            .filter(Company.id == root_company_id)
-                            .first()
-                        )
-                    else:
-                        billing_company = user_direct_company
-
-                    if billing_company:
-                        if pricing_model == "tiered_plan":
-                            # For tiered plans: check period reset, then track usage
-                            # Reset period if needed (billing cycle anniversary)
-                            now = datetime.now(timezone.utc)
-                            period_start = billing_company.current_period_start
-                            if period_start:
-                                # Ensure period_start is timezone-aware for comparison
-                                if (
-                                    period_start.tzinfo is None
-                                    or period_start.tzinfo.utcoffset(period_start)
-                                    is None
-                                ):
-                                    period_start = period_start.replace(
-                                        tzinfo=timezone.utc
-                                    )
-                                from dateutil.relativedelta import relativedelta
-
-                                if now >= period_start + relativedelta(months=1):
-                                    billing_company.tokens_used_this_period = 0
-                                    billing_company.current_period_start = now
-                            else:
-                                billing_company.current_period_start = now
-
-                            # Track period token usage
-                            billing_company.tokens_used_this_period = (
-                                billing_company.tokens_used_this_period or 0
-                            ) + total_tokens
-
-                            # Check if plan's monthly allowance is exhausted
-                            plan_id = billing_company.plan_id
-                            tier = self._get_plan_tier(plan_id, pricing_config)
-                            limits = tier.get("limits", {})
-                            plan_token_limit = (limits.get("tokens") or 0) + (
-                                billing_company.addon_tokens or 0
-                            )
-
-                            tokens_used = billing_company.tokens_used_this_period or 0
-
-                            if plan_token_limit and tokens_used > plan_token_limit:
-                                # Over the plan's included allowance — use purchased topup tokens
-                                overage = tokens_used - plan_token_limit
-                                if (
-                                    billing_company.token_balance
-                                    and billing_company.token_balance > 0
-                                ):
-                                    # Deduct only the overage portion from topup balance
-                                    deduction = min(
-                                        total_tokens,
-                                        overage,
-                                        billing_company.token_balance,
-                                    )
-                                    billing_company.token_balance -= deduction
-                                    if billing_company.token_balance < 0:
-                                        billing_company.token_balance = 0
-                                elif billing_enabled:
-                                    # Over limit and no topup balance
-                                    if (billing_company.token_balance_usd or 0) <= 0:
-                                        raise HTTPException(
-                                            status_code=402,
-                                            detail="Monthly token limit exceeded. Purchase additional tokens ($5/1M) or upgrade your plan.",
-                                        )
-                        else:
-                            # Legacy token-based billing
-                            if (billing_company.token_balance or 0) < total_tokens:
-                                session.close()
-                                raise HTTPException(
-                                    status_code=402,
-                                    detail="Insufficient token balance. Please top up your company's token balance.",
-                                )
-                            billing_company.token_balance -= total_tokens
-
-                        billing_company.tokens_used_total = (
-                            billing_company.tokens_used_total or 0
-                        ) + total_tokens
-
+                if charged is not None:
                     # Record usage for audit trail
-                    usage = CompanyTokenUsage(
-                        company_id=user_direct_company.id,
-                        user_id=self.user_id,
-                        input_tokens=input_tokens,
-                        output_tokens=output_tokens,
-                        total_tokens=total_tokens,
-                    )
-                    session.add(usage)
+                    audit_company_id = user_company.company_id
+
+            # Analytics rollups, whether or not billing is enabled
+            now = datetime.now()
+            rolled_up = record_usage(
+                session,
+                UsageRollup,
+                company_id=user_company.company_id if user_company else None,
+                user_id=self.user_id,
+                agent_id=agent_id,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                timestamp=now,
+            )
+            if audit_company_id is not None:
+                usage = CompanyTokenUsage(
+                    company_id=audit_company_id,
+                    user_id=self.user_id,
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    total_tokens=total_tokens,
+                    timestamp=now,
+                    agent_id=str(agent_id) if agent_id else None,
+                    rolled_up=rolled_up,
+                )
+                session.add(usage)
 
             # Track per-user for analytics — inline to avoid extra session from get_token_counts()
             user_preferences = (
@@ -3,36 +3,73 @@ import os
 import asyncio
 import sys
 import base64
+import json
 from hashlib import sha256
 from DB import (
     Memory,
     Agent,
+    Conversation,
     User,
     get_session,
     get_similar_memories,
     process_embedding_for_storage,
 )
+from HybridRetrieval import (
+    MIN_LEXICAL_TERM_COVERAGE,
+    MemoryFilters,
+    candidate_count,
+    lexical_search,
+    query_terms,
+    rank_by_similarity,
+    reciprocal_rank_fusion,
+    term_coverage,
+)
 from middleware import log_silenced_exception
 from SharedCache import shared_cache
 import spacy
 from numpy import array, linalg, ndarray
 from collections import Counter
 from typing import List
-from Globals import getenv, DEFAULT_USER
+from Globals import getenv, get_tokens, DEFAULT_USER
 
 # Removed textacy dependency - using spaCy-based keyword extraction
 from youtube_transcript_api import YouTubeTranscriptApi
 
-# Suppress onnxruntime C++ GPU device discovery warnings in containers without GPUs
-os.environ.setdefault("ORT_LOG_LEVEL", "3")  # ERROR level only
-from onnxruntime import InferenceSession
-from tokenizers import Tokenizer
-from typing import List, cast, Union, Sequence
+from typing import (
+    AsyncIterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Sequence,
+)
 from numpy import array, linalg, ndarray
 import numpy as np
 from datetime import datetime
 from uuid import UUID
 from WebhookManager import webhook_emitter
+from MemoryCompaction import content_hash, memory_compaction
+from MemoryLifecycle import (
+    POLICY_SETTING,
+    memory_lifecycle,
+    validate_policy_document,
+)
+from Summarization import MapReduceSummarizer, SummaryResult
+from EmbeddingService import local_embedder
+from Reranker import (
+    RERANK_CANDIDATES,
+    RerankResult,
+    memory_reranker,
+    select_within_budget,
+)
+from MemoryTransfer import (
+    EXPORT_BATCH_SIZE,
+    embedding_model_fingerprint,
+    export_ndjson,
+    import_ndjson,
+    iter_ndjson,
+)
 
 logging.basicConfig(
     level=getenv("LOG_LEVEL"),
@@ -57,51 +94,8 @@ def nlp(text):
     return _spacy_nlp(text)
 
 
-_onnx_tokenizer = None
-_onnx_model = None
-
-
 def embed(input: List[str]) -> List[Union[Sequence[float], Sequence[int]]]:
-    global _onnx_tokenizer, _onnx_model
-    if _onnx_tokenizer is None:
-        _onnx_tokenizer = Tokenizer.from_file(
-            os.path.join(os.getcwd(), "onnx", "tokenizer.json")
-        )
-        _onnx_tokenizer.enable_truncation(max_length=256)
-        _onnx_tokenizer.enable_padding(pad_id=0, pad_token="[PAD]", length=256)
-    if _onnx_model is None:
-        _onnx_model = InferenceSession(os.path.join(os.getcwd(), "onnx", "model.onnx"))
-    tokenizer = _onnx_tokenizer
-    model = _onnx_model
-    all_embeddings = []
-    for i in range(0, len(input), 32):
-        batch = input[i : i + 32]
-        encoded = [tokenizer.encode(d) for d in batch]
-        input_ids = np.array([e.ids for e in encoded])
-        attention_mask = np.array([e.attention_mask for e in encoded])
-        onnx_input = {
-            "input_ids": np.array(input_ids, dtype=np.int64),
-            "attention_mask": np.array(attention_mask, dtype=np.int64),
-            "token_type_ids": np.array(
-                [np.zeros(len(e), dtype=np.int64) for e in input_ids],
-                dtype=np.int64,
-            ),
-        }
-        model_output = model.run(None, onnx_input)
-        last_hidden_state = model_output[0]
-        input_mask_expanded = np.broadcast_to(
-            np.expand_dims(attention_mask, -1), last_hidden_state.shape
-        )
-        embeddings = np.sum(last_hidden_state * input_mask_expanded, 1) / np.clip(
-            input_mask_expanded.sum(1), a_min=1e-9, a_max=None
-        )
-        norm = np.linalg.norm(embeddings, axis=1)
-        norm[norm == 0] = 1e-12
-        embeddings = (embeddings / norm[:, np.newaxis]).astype(np.float32)
-        all_embeddings.append(embeddings)
-    return cast(
-        List[Union[Sequence[float], Sequence[int]]], np.concatenate(all_embeddings)
-    ).tolist()
+    return local_embedder(input)
 
 
 def extract_keywords(doc=None, text="", limit=10):
@@ -672,6 +666,129 @@ class Memories:
                             e, "import_collections_from_json: writing memory"
                         )
 
+    def export_memories_ndjson(
+        self, include_embeddings: bool = True
+    ) -> Iterator[bytes]:
+        """Stream every memory for the agent as NDJSON lines (see MemoryTransfer)"""
+        session = get_session()
+        try:
+            rows = (
+                session.query(
+                    Memory.conversation_id,
+                    Memory.text,
+                    Memory.description,
+                    Memory.external_source,
+                    Memory.additional_metadata,
+                    Memory.timestamp,
+                    Memory.embedding,
+                )
+                .filter(Memory.agent_id == self.agent_id)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            yield from export_ndjson(
+                rows,
+                fingerprint=embedding_model_fingerprint(),
+                agent_name=self.agent_name,
+                include_embeddings=include_embeddings,
+            )
+        finally:
+            session.close()
+
+    async def import_memories_ndjson(self, chunks: AsyncIterable[bytes]) -> dict:
+        """
+        Import an NDJSON export, keeping its vectors when the embedding model
+        matches ours and re-embedding the text when it does not.
+        """
+        from MagicalAuth import get_user_id, get_user_company_id_by_email
+
+        try:
+            user_id = get_user_id(self.user)
+            company_id = get_user_company_id_by_email(self.user)
+        except:
+            user_id = self.user
+            company_id = None
+        session = get_session()
+
+        def resolve_collection(collection: str):
+            if collection == "0":
+                return None
+            try:
+                conversation_id = str(UUID(collection))
+            except ValueError:
+                raise LookupError(f"Invalid collection id {collection}")
+            conversation = (
+                session.query(Conversation.id)
+                .filter_by(id=conversation_id, user_id=user_id)
+                .first()
+            )
+            if not conversation:
+                raise LookupError(
+                    f"Conversation {collection} not found, its memories were skipped"
+                )
+            return conversation_id
+
+        def insert_rows(rows: List[dict]) -> int:
+            for row in rows:
+                row["agent_id"] = self.agent_id
+                row["content_hash"] = content_hash(row["text"])
+            # Re-importing the same export must not duplicate memories
+            existing = {
+                (str(conversation_id) if conversation_id else None, source, digest)
+                for conversation_id, source, digest in session.query(
+                    Memory.conversation_id,
+                    Memory.external_source,
+                    Memory.content_hash,
+                )
+                .filter(
+                    Memory.agent_id == self.agent_id,
+                    Memory.content_hash.in_({row["content_hash"] for row in rows}),
+                )
+                .all()
+            }
+            new_rows = []
+            for row in rows:
+                key = (
+                    row["conversation_id"],
+                    row["external_source"],
+                    row["content_hash"],
+                )
+                if key not in existing:
+                    existing.add(key)
+                    new_rows.append(row)
+            if new_rows:
+                session.bulk_insert_mappings(Memory, new_rows)
+                session.commit()
+            return len(new_rows)
+
+        try:
+            report = await import_ndjson(
+                iter_ndjson(chunks),
+                fingerprint=embedding_model_fingerprint(),
+                insert_rows=insert_rows,
+                embed_texts=embed,
+                resolve_collection=resolve_collection,
+            )
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if report.imported:
+            await webhook_emitter.emit_event(
+                event_type="memory.created",
+                user_id=str(user_id),
+                company_id=company_id,
+                agent_id=self.agent_id,
+                agent_name=self.agent_name,
+                data={
+                    "external_source": "memory import",
+                    "chunk_count": report.imported,
+                    "reembedded": report.reembedded,
+                },
+            )
+        return report.to_dict()
+
     # get collections that start with the collection name
     async def get_collection(self):
         """Emulate ChromaDB collection interface using SQL"""
@@ -737,23 +854,43 @@ class Memories:
         except:
             return False
 
-    async def summarize_text(self, text: str) -> str:
+    async def summarize(self, text: str, token_budget: int = None) -> SummaryResult:
+        """
+        Map-reduce summary of text: chunks are summarized concurrently and the
+        partial summaries reduced until they fit token_budget (default: half
+        the agent's MAX_TOKENS). The result includes the token usage.
+        """
         # Chunk size is 1/2 the max tokens of the agent
         try:
-            chunk_size = int(self.agent_config["settings"]["MAX_TOKENS"]) / 2
+            chunk_size = int(self.agent_config["settings"]["MAX_TOKENS"]) // 2
         except:
             chunk_size = 2000
-        chunks = await self.chunk_content(text=text, chunk_size=chunk_size)
-        summary = ""
-        for chunk in chunks:
+
+        async def summarize_chunk(chunk: str, stage: str) -> str:
             # Prompt the agent asking to summarize the information in the chunk.
-            response = await self.ApiClient.prompt_agent(
+            return await self.ApiClient.prompt_agent_async(
                 agent_id=self.agent_id,
                 prompt_name="Summarize Content",
                 prompt_args={"user_input": chunk},
             )
-            summary += response
-        return summary
+
+        async def chunk_in_order(text: str, chunk_size: int) -> List[str]:
+            return await self.chunk_content(
+                text=text, chunk_size=chunk_size, sort_by_score=False
+            )
+
+        summarizer = MapReduceSummarizer(
+            summarize=summarize_chunk,
+            chunker=chunk_in_order,
+            count_tokens=get_tokens,
+            chunk_size=chunk_size,
+            cache_namespace=f"{self.agent_id}:Summarize Content",
+        )
+        return await summarizer.run(text, token_budget=token_budget)
+
+    async def summarize_text(self, text: str, token_budget: int = None) -> str:
+        result = await self.summarize(text=text, token_budget=token_budget)
+        return result.summary
 
     async def write_text_to_memory(
         self, user_input: str, text: str, external_source: str = "user input"
@@ -788,9 +925,37 @@ class Memories:
                     external_source=external_source,
                 ).delete()
 
+            # Skip chunks this source already wrote to the collection so
+            # repeated learning does not pile up duplicate rows. Other sources
+            # keep their own copy: deleting one source must not take content
+            # another source still provides.
+            chunk_hashes = [content_hash(chunk) for chunk in chunks]
+            existing_hashes = {
+                row[0]
+                for row in session.query(Memory.content_hash)
+                .filter(
+                    Memory.agent_id == self.agent_id,
+                    Memory.conversation_id == conversation_id,
+                    Memory.external_source == external_source,
+                    Memory.content_hash.in_(set(chunk_hashes)),
+                )
+                .all()
+            }
+            new_chunks = []
+            for chunk, chunk_hash in zip(chunks, chunk_hashes):
+                if chunk_hash not in existing_hashes:
+                    existing_hashes.add(chunk_hash)
+                    new_chunks.append((chunk, chunk_hash))
+            if chunks and not new_chunks:
+                session.commit()
+                logging.debug(
+                    f"All {len(chunks)} chunks already in memory, nothing to add"
+                )
+                return True
+
             # Process all chunks first to ensure they're valid
             memories_to_add = []
-            for chunk in chunks:
+            for chunk, chunk_hash in new_chunks:
                 # Get embedding and ensure proper shape
                 try:
                     chunk_embedding = embed([chunk])
@@ -810,6 +975,7 @@ class Memories:
                         external_source=external_source,
                         description=user_input,
                         additional_metadata=chunk,
+                        content_hash=chunk_hash,
                     )
                     # Validate memory object
                     if not memory.agent_id:
@@ -863,103 +1029,265 @@ class Memories:
             session.close()
 
     # Update the get_memories_data method:
-    async def get_memories_data(
-        self,
-        user_input: str,
-        limit: int,
-        min_relevance_score: float = 0.0,
-    ) -> List[dict]:
-        if not user_input:
-            return []
-
+    def _vector_candidates(
+        self, query_embedding, conversation_id, limit, min_relevance_score, filters
+    ):
         session = get_session()
         try:
-            query_embedding = embed([user_input])[0]
-            conversation_id = (
-                None if self.collection_number == "0" else self.collection_number
-            )
-
-            # Get similar memories using the new helper function
-            memory_results = get_similar_memories(
+            return get_similar_memories(
                 session,
                 query_embedding,
                 self.agent_id,
                 conversation_id,
                 limit,
                 min_relevance_score,
+                filters=filters,
             )
+        finally:
+            session.close()
 
-            # Format results
-            memories = []
-            for memory, similarity in memory_results:
-                memories.append(
-                    {
-                        "external_source_name": memory.external_source,
-                        "id": str(memory.id),
-                        "key": str(memory.id),
-                        "description": memory.description,
-                        "text": memory.text,
-                        "embedding": (
-                            memory.embedding.tolist()
-                            if isinstance(memory.embedding, np.ndarray)
-                            else memory.embedding
-                        ),
-                        "additional_metadata": memory.additional_metadata,
-                        "timestamp": format_timestamp_iso(memory.timestamp),
-                        "relevance_score": float(similarity),
-                    }
-                )
-
-            return memories
+    def _lexical_candidates(self, user_input, conversation_id, limit, filters):
+        session = get_session()
+        try:
+            return lexical_search(
+                session,
+                user_input,
+                self.agent_id,
+                conversation_id,
+                limit=limit,
+                filters=filters,
+            )
+        finally:
+            session.close()
 
+    def _load_memories(self, memory_ids: List[str]) -> dict:
+        session = get_session()
+        try:
+            return {
+                str(memory.id): memory
+                for memory in session.query(Memory)
+                .filter(Memory.id.in_(memory_ids))
+                .all()
+            }
         finally:
             session.close()
 
-    # Update the get_memories method similarly:
-    async def get_memories(
+    async def search_memories(
         self,
         user_input: str,
         limit: int,
         min_relevance_score: float = 0.0,
-    ) -> List[str]:
-        session = get_session()
-        try:
-            query_embedding = embed([user_input])[0]
-            conversation_id = (
-                None if self.collection_number == "0" else self.collection_number
-            )
+        filters: Optional[MemoryFilters] = None,
+        hybrid: Optional[bool] = None,
+        rerank: Optional[bool] = None,
+        token_budget: Optional[int] = None,
+    ) -> List[Tuple[Memory, float]]:
+        """
+        Find the memories most relevant to the input.
+
+        With hybrid search (the default, see MEMORY_HYBRID_SEARCH) a full-text
+        query runs alongside the vector query and the two rankings are merged
+        with reciprocal rank fusion, so exact identifiers and error codes are
+        found even when their embeddings are not close. `min_relevance_score`
+        applies to vector matches. A lexical-only match is kept when its cosine
+        similarity clears `min_relevance_score` or it contains at least
+        MIN_LEXICAL_TERM_COVERAGE of the query terms.
+
+        With reranking (the default, see MEMORY_RERANK) the top
+        MEMORY_RERANK_CANDIDATES matches are rescored against the input by the
+        local cross-encoder, or lexically when none is installed, before the
+        best `limit` are kept. `token_budget` caps the total tokens of the
+        returned memories' text.
+
+        Returns (memory, cosine similarity) pairs, best first.
+        """
+        if rerank is None:
+            rerank = str(getenv("MEMORY_RERANK", "true")).lower() == "true"
+        pool = max(limit, RERANK_CANDIDATES) if rerank else limit
+        results = await self._first_stage_memories(
+            user_input, pool, min_relevance_score, filters, hybrid
+        )
+        if rerank or token_budget:
+            by_id = {str(memory.id): (memory, score) for memory, score in results}
+            candidates = [(str(memory.id), memory.text) for memory, _ in results]
+            if rerank:
+                selected = await asyncio.to_thread(
+                    memory_reranker.rerank,
+                    user_input,
+                    candidates,
+                    limit,
+                    token_budget,
+                )
+            else:
+                selected = select_within_budget(
+                    [
+                        RerankResult(key=key, score=0.0, prior_rank=index)
+                        for index, (key, _) in enumerate(candidates)
+                    ],
+                    dict(candidates),
+                    limit=limit,
+                    token_budget=token_budget,
+                    count_tokens=get_tokens,
+                )
+            results = [by_id[result.key] for result in selected]
+        memory_lifecycle.record_retrieval(memory.id for memory, _ in results)
+        return results
 
-            # Get similar memories using the new helper function
-            memory_results = get_similar_memories(
-                session,
+    async def _first_stage_memories(
+        self,
+        user_input: str,
+        limit: int,
+        min_relevance_score: float = 0.0,
+        filters: Optional[MemoryFilters] = None,
+        hybrid: Optional[bool] = None,
+    ) -> List[Tuple[Memory, float]]:
+        if hybrid is None:
+            hybrid = str(getenv("MEMORY_HYBRID_SEARCH", "true")).lower() == "true"
+        query_embedding = embed([user_input])[0]
+        conversation_id = (
+            None if self.collection_number == "0" else self.collection_number
+        )
+        if not hybrid:
+            return await asyncio.to_thread(
+                self._vector_candidates,
                 query_embedding,
-                self.agent_id,
                 conversation_id,
                 limit,
                 min_relevance_score,
+                filters,
             )
+        candidates = candidate_count(limit)
+        vector_results, lexical_results = await asyncio.gather(
+            asyncio.to_thread(
+                self._vector_candidates,
+                query_embedding,
+                conversation_id,
+                candidates,
+                min_relevance_score,
+                filters,
+            ),
+            asyncio.to_thread(
+                self._lexical_candidates,
+                user_input,
+                conversation_id,
+                candidates,
+                filters,
+            ),
+        )
+        similarities = {str(memory.id): score for memory, score in vector_results}
+        memories = {str(memory.id): memory for memory, _ in vector_results}
+        missing = [
+            memory_id for memory_id, _ in lexical_results if memory_id not in memories
+        ]
+        if missing:
+            loaded = await asyncio.to_thread(self._load_memories, missing)
+            for memory_id, score in rank_by_similarity(
+                query_embedding,
+                [(memory_id, memory.embedding) for memory_id, memory in loaded.items()],
+                limit=len(loaded),
+                min_score=-1.0,
+            ):
+                similarities[memory_id] = score
+            # The full-text query matches any one term, so hold lexical-only
+            # hits to the relevance floor or to a share of the query terms
+            terms = query_terms(user_input)
+            for memory_id, memory in loaded.items():
+                if similarities.get(memory_id, -1.0) >= min_relevance_score or (
+                    term_coverage(terms, memory.text or "") >= MIN_LEXICAL_TERM_COVERAGE
+                ):
+                    memories[memory_id] = memory
+        fused = reciprocal_rank_fusion(
+            [
+                [str(memory.id) for memory, _ in vector_results],
+                [
+                    memory_id
+                    for memory_id, _ in lexical_results
+                    if memory_id in memories
+                ],
+            ]
+        )[:limit]
+        return [
+            (memories[memory_id], similarities.get(memory_id, 0.0))
+            for memory_id, _ in fused
+        ]
 
-            # Format results
-            response = []
-            for memory, similarity in memory_results:
-                metadata = (
-                    memory.additional_metadata if memory.additional_metadata else ""
-                )
-                external_source = (
-                    memory.external_source if memory.external_source else None
-                )
-                timestamp = format_timestamp(memory.timestamp)
+    async def get_memories_data(
+        self,
+        user_input: str,
+        limit: int,
+        min_relevance_score: float = 0.0,
+        filters: Optional[MemoryFilters] = None,
+        hybrid: Optional[bool] = None,
+        rerank: Optional[bool] = None,
+        token_budget: Optional[int] = None,
+    ) -> List[dict]:
+        if not user_input:
+            return []
 
-                if external_source:
-                    metadata = f"Sourced from {external_source}:\nSourced on: {timestamp}\n{metadata}"
+        memory_results = await self.search_memories(
+            user_input=user_input,
+            limit=limit,
+            min_relevance_score=min_relevance_score,
+            filters=filters,
+            hybrid=hybrid,
+            rerank=rerank,
+            token_budget=token_budget,
+        )
 
-                if metadata not in response and metadata != "":
-                    response.append(metadata)
+        # Format results
+        memories = []
+        for memory, similarity in memory_results:
+            memories.append(
+                {
+                    "external_source_name": memory.external_source,
+                    "id": str(memory.id),
+                    "key": str(memory.id),
+                    "description": memory.description,
+                    "text": memory.text,
+                    "embedding": (
+                        memory.embedding.tolist()
+                        if isinstance(memory.embedding, np.ndarray)
+                        else memory.embedding
+                    ),
+                    "additional_metadata": memory.additional_metadata,
+                    "timestamp": format_timestamp_iso(memory.timestamp),
+                    "relevance_score": float(similarity),
+                }
+            )
 
-            return response
+        return memories
 
-        finally:
-            session.close()
+    # Update the get_memories method similarly:
+    async def get_memories(
+        self,
+        user_input: str,
+        limit: int,
+        min_relevance_score: float = 0.0,
+        filters: Optional[MemoryFilters] = None,
+        token_budget: Optional[int] = None,
+    ) -> List[str]:
+        memory_results = await self.search_memories(
+            user_input=user_input,
+            limit=limit,
+            min_relevance_score=min_relevance_score,
+            filters=filters,
+            token_budget=token_budget,
+        )
+
+        # Format results
+        response = []
+        for memory, similarity in memory_results:
+            metadata = memory.additional_metadata if memory.additional_metadata else ""
+            external_source = memory.external_source if memory.external_source else None
+            timestamp = format_timestamp(memory.timestamp)
+
+            if external_source:
+                metadata = f"Sourced from {external_source}:\nSourced on: {timestamp}\n{metadata}"
+
+            if metadata not in response and metadata != "":
+                response.append(metadata)
+
+        return response
 
     async def get_external_data_sources(self):
         session = get_session()
@@ -984,6 +1312,68 @@ class Memories:
         finally:
             session.close()
 
+    async def has_external_source(self, external_source: str) -> bool:
+        """Whether this collection holds any memory from the source"""
+        conversation_id = (
+            None if self.collection_number == "0" else self.collection_number
+        )
+
+        def query():
+            session = get_session()
+            try:
+                return (
+                    session.query(Memory.id)
+                    .filter_by(
+                        agent_id=self.agent_id,
+                        conversation_id=conversation_id,
+                        external_source=external_source,
+                    )
+                    .first()
+                    is not None
+                )
+            finally:
+                session.close()
+
+        return await asyncio.to_thread(query)
+
+    async def compact_memories(self, dry_run: bool = False) -> dict:
+        """
+        Merge exact and near-duplicate memories in this collection, keeping
+        the newest copy of each and noting the other sources it came from.
+        """
+        conversation_id = (
+            None if self.collection_number == "0" else self.collection_number
+        )
+        result = await memory_compaction.compact_agent(
+            agent_id=self.agent_id, conversation_id=conversation_id, dry_run=dry_run
+        )
+        return result.to_dict()
+
+    def lifecycle_policy_document(self) -> Optional[dict]:
+        """The agent's memory_lifecycle_policy setting, parsed"""
+        value = self.agent_settings.get(POLICY_SETTING)
+        if not value:
+            return None
+        document = json.loads(value) if isinstance(value, str) else value
+        validate_policy_document(document)
+        return document
+
+    async def lifecycle_report(self) -> List[dict]:
+        """Size, age and pending lifecycle removals of every collection"""
+        return await memory_lifecycle.report(
+            agent_id=self.agent_id, agent_policy=self.lifecycle_policy_document()
+        )
+
+    async def enforce_lifecycle(self, dry_run: bool = False) -> dict:
+        """Apply the lifecycle policy to this collection now"""
+        conversation_id = (
+            None if self.collection_number == "0" else self.collection_number
+        )
+        result = await memory_lifecycle.enforce_agent(
+            agent_id=self.agent_id, conversation_id=conversation_id, dry_run=dry_run
+        )
+        return result.to_dict()
+
     async def delete_memories_from_external_source(self, external_source: str):
         session = get_session()
         try:
@@ -1032,7 +1422,13 @@ class Memories:
         score = sum(chunk_counter[keyword] for keyword in keywords)
         return score
 
-    async def chunk_content(self, text: str, chunk_size: int) -> List[str]:
+    async def chunk_content(
+        self, text: str, chunk_size: int, sort_by_score: bool = True
+    ) -> List[str]:
+        """
+        Split text into chunks of whole sentences of about chunk_size tokens,
+        most keyword-dense first unless sort_by_score is False.
+        """
         doc = nlp(text)
         sentences = list(doc.sents)
         content_chunks = []
@@ -1057,7 +1453,8 @@ class Memories:
             content_chunks.append((self.score_chunk(chunk_text, keywords), chunk_text))
 
         # Sort the chunks by their score in descending order before returning them
-        content_chunks.sort(key=lambda x: x[0], reverse=True)
+        if sort_by_score:
+            content_chunks.sort(key=lambda x: x[0], reverse=True)
         return [chunk_text for score, chunk_text in content_chunks]
 
     async def get_transcription(self, video_id: str = None):
@@ -0,0 +1,442 @@
+"""
+MemoryCompaction - Duplicate detection and merging for agent memories
+
+Re-learning the same URL, file or search result writes near-identical chunks
+again and again. This module:
+
+- hashes normalised chunk text (`content_hash`) so writes can skip chunks the
+  same source already wrote to the collection;
+- plans compaction of a collection: exact duplicates share a content hash,
+  near duplicates have embeddings at or above a cosine similarity threshold
+  and the same numbers in their text;
+- merges each duplicate group into its newest row, recording where the
+  removed copies came from on a provenance line in `additional_metadata`;
+- runs as a background service (opt-in, MEMORY_COMPACTION_ENABLED) that
+  compacts collections which have grown since they were last compacted, one
+  worker at a time.
+
+Duplicates are only grouped within one external_source. Deleting a source's
+memories (or re-learning a file, which deletes by source first) must never
+remove content that another source still provides.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity at or above which two chunks are considered the same
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.97"))
+
+# Collections larger than this are only compacted for exact duplicates
+MAX_NEAR_DUPLICATE_ROWS = int(os.getenv("MEMORY_DEDUP_MAX_ROWS", "20000"))
+
+COMPACTION_INTERVAL = float(os.getenv("MEMORY_COMPACTION_INTERVAL_HOURS", "6")) * 3600
+
+# Rows compared against the kept set per matrix multiplication
+SIMILARITY_BLOCK = 512
+
+PROVENANCE_PREFIX = "Also sourced from: "
+MAX_PROVENANCE_SOURCES = 10
+
+_WHITESPACE = re.compile(r"\s+")
+_FIGURES = re.compile(r"\d+(?:[.,:/-]\d+)*")
+
+
+def content_hash(text: str) -> str:
+    """Hash of the chunk text ignoring case and whitespace differences"""
+    normalised = _WHITESPACE.sub(" ", (text or "").strip()).casefold()
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class DuplicateGroup:
+    keep: Any
+    exact: List[Any] = field(default_factory=list)
+    near: List[Any] = field(default_factory=list)
+
+    @property
+    def duplicates(self) -> List[Any]:
+        return self.exact + self.near
+
+
+@dataclass
+class CompactionResult:
+    scanned: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+    removed: int = 0
+    merged_groups: int = 0
+    hashes_backfilled: int = 0
+    near_duplicate_scan_skipped: bool = False
+    dry_run: bool = False
+    duration: float = 0.0
+
+    def add(self, other: "CompactionResult"):
+        for name in (
+            "scanned",
+            "exact_duplicates",
+            "near_duplicates",
+            "removed",
+            "merged_groups",
+            "hashes_backfilled",
+        ):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.near_duplicate_scan_skipped |= other.near_duplicate_scan_skipped
+        self.duration += other.duration
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _newest_first(rows: Sequence[Any]) -> List[Any]:
+    return sorted(rows, key=lambda row: row.timestamp or datetime.min, reverse=True)
+
+
+def _figures(text: str) -> frozenset:
+    return frozenset(_FIGURES.findall(text or ""))
+
+
+def _by_source(rows: Sequence[Any]) -> Dict[Any, List[Any]]:
+    sources: Dict[Any, List[Any]] = {}
+    for row in rows:
+        sources.setdefault(getattr(row, "external_source", None), []).append(row)
+    return sources
+
+
+def plan_compaction(
+    rows: Sequence[Any],
+    threshold: float = NEAR_DUPLICATE_THRESHOLD,
+    max_near_rows: int = MAX_NEAR_DUPLICATE_ROWS,
+) -> List[DuplicateGroup]:
+    """
+    Group duplicate rows of one collection.
+
+    Rows need `id`, `text`, `embedding`, `timestamp`, `external_source` and
+    `content_hash` (None is fine; it is computed). Rows are only grouped with
+    rows of the same external_source, and the newest row of each group is
+    kept. Near-duplicate matching is greedy: each row joins the most similar
+    kept row if that similarity reaches `threshold` and both texts contain the
+    same numbers, so "retries 3 times" never absorbs "retries 5 times".
+    """
+    groups = []
+    for source_rows in _by_source(rows).values():
+        groups += _plan_source(source_rows, threshold, max_near_rows)
+    return groups
+
+
+def _plan_source(
+    rows: Sequence[Any], threshold: float, max_near_rows: int
+) -> List[DuplicateGroup]:
+    groups: Dict[Any, DuplicateGroup] = {}
+    survivors = []
+    by_hash: Dict[str, Any] = {}
+    for row in _newest_first(rows):
+        digest = row.content_hash or content_hash(row.text)
+        keep = by_hash.get(digest)
+        if keep is None:
+            by_hash[digest] = row
+            survivors.append(row)
+            continue
+        groups.setdefault(keep.id, DuplicateGroup(keep)).exact.append(row)
+    if threshold >= 1.0 or len(survivors) > max_near_rows:
+        return list(groups.values())
+
+    dimensions = None
+    kept_rows = []
+    kept_vectors = np.zeros((0, 0), dtype=np.float32)
+    candidates = []
+    for row in survivors:
+        if row.embedding is None:
+            continue
+        vector = np.asarray(row.embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            continue
+        if dimensions is None:
+            dimensions = vector.shape[0]
+            kept_vectors = np.zeros((0, dimensions), dtype=np.float32)
+        if vector.shape[0] != dimensions:
+            continue
+        candidates.append((row, vector / norm))
+
+    for start in range(0, len(candidates), SIMILARITY_BLOCK):
+        block = candidates[start : start + SIMILARITY_BLOCK]
+        block_matrix = np.vstack([vector for _, vector in block])
+        scores = (
+            block_matrix @ kept_vectors.T
+            if len(kept_rows)
+            else np.zeros((len(block), 0), dtype=np.float32)
+        )
+        new_rows = []
+        new_vectors = []
+        for index, (row, vector) in enumerate(block):
+            best_score = -1.0
+            best_row = None
+            if scores.shape[1]:
+                best = int(np.argmax(scores[index]))
+                best_score, best_row = float(scores[index][best]), kept_rows[best]
+            # Rows kept earlier in this block are not in `scores` yet
+            if new_vectors:
+                local = np.vstack(new_vectors) @ vector
+                local_best = int(np.argmax(local))
+                if float(local[local_best]) > best_score:
+                    best_score = float(local[local_best])
+                    best_row = new_rows[local_best]
+            if (
+                best_row is not None
+                and best_score >= threshold
+                and _figures(row.text) == _figures(best_row.text)
+            ):
+                group = groups.setdefault(best_row.id, DuplicateGroup(best_row))
+                group.near.append(row)
+                # The row's own exact duplicates follow it into this group
+                absorbed = groups.pop(row.id, None)
+                if absorbed:
+                    group.exact += absorbed.exact
+                    group.near += absorbed.near
+            else:
+                new_rows.append(row)
+                new_vectors.append(vector)
+        if new_rows:
+            kept_rows.extend(new_rows)
+            kept_vectors = np.vstack([kept_vectors, np.vstack(new_vectors)])
+    return list(groups.values())
+
+
+def _split_provenance(metadata: str):
+    lines = (metadata or "").split("\n")
+    sources = []
+    body = []
+    for line in lines:
+        if line.startswith(PROVENANCE_PREFIX):
+            sources += [
+                source.strip()
+                for source in line[len(PROVENANCE_PREFIX) :].split(";")
+                if source.strip()
+            ]
+        else:
+            body.append(line)
+    return "\n".join(body).rstrip("\n"), sources
+
+
+def merge_provenance(keep: Any, duplicates: Sequence[Any]) -> str:
+    """
+    additional_metadata for the surviving row: its own content followed by a
+    single line naming the other sources the duplicates came from.
+    """
+    body, sources = _split_provenance(keep.additional_metadata or keep.text)
+    seen = {keep.external_source} | {source.split(" (")[0] for source in sources}
+    for row in duplicates:
+        _, inherited = _split_provenance(row.additional_metadata)
+        entries = inherited
+        if row.external_source:
+            stamp = row.timestamp.strftime("%Y-%m-%d") if row.timestamp else ""
+            entries = [
+                f"{row.external_source} ({stamp})" if stamp else row.external_source
+            ] + inherited
+        for entry in entries:
+            name = entry.split(" (")[0]
+            if name not in seen:
+                seen.add(name)
+                sources.append(entry)
+    sources = sources[:MAX_PROVENANCE_SOURCES]
+    if not sources:
+        return keep.additional_metadata
+    return f"{body}\n{PROVENANCE_PREFIX}{'; '.join(sources)}"
+
+
+def compact_collection(
+    session,
+    model,
+    agent_id,
+    conversation_id=None,
+    threshold: float = NEAR_DUPLICATE_THRESHOLD,
+    dry_run: bool = False,
+) -> CompactionResult:
+    """
+    Merge duplicate memories in one agent collection.
+
+    `model` is the Memory ORM class. Missing content hashes are backfilled as
+    a side effect (skipped on dry runs).
+    """
+    started = time.monotonic()
+    result = CompactionResult(dry_run=dry_run)
+    rows = (
+        session.query(model)
+        .filter(
+            model.agent_id == agent_id,
+            model.conversation_id == conversation_id,
+        )
+        .all()
+    )
+    result.scanned = len(rows)
+    for row in rows:
+        if not row.content_hash:
+            result.hashes_backfilled += 1
+            if not dry_run:
+                row.content_hash = content_hash(row.text)
+    result.near_duplicate_scan_skipped = threshold < 1.0 and any(
+        len(source_rows) > MAX_NEAR_DUPLICATE_ROWS
+        for source_rows in _by_source(rows).values()
+    )
+    groups = plan_compaction(rows, threshold=threshold)
+    for group in groups:
+        result.merged_groups += 1
+        result.exact_duplicates += len(group.exact)
+        result.near_duplicates += len(group.near)
+        result.removed += len(group.duplicates)
+        if dry_run:
+            continue
+        group.keep.additional_metadata = merge_provenance(group.keep, group.duplicates)
+        for row in group.duplicates:
+            session.delete(row)
+    if dry_run:
+        session.rollback()
+    else:
+        session.commit()
+    result.duration = time.monotonic() - started
+    return result
+
+
+class MemoryCompactionService:
+    """
+    Periodically compacts memory collections that have grown.
+
+    One worker per interval wins a shared-cache lock and does the pass; each
+    collection's row count is remembered so unchanged collections are
+    skipped next time. Totals are available from get_stats.
+    """
+
+    def __init__(self, interval: float = COMPACTION_INTERVAL, cache=None):
+        self.interval = interval
+        self.cache = cache or shared_cache
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self._stats = CompactionResult()
+        self._runs = 0
+        self._last_run: Optional[str] = None
+
+    async def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self.running = False
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _loop(self):
+        # Stagger workers so they do not all race for the lock at boot
+        await asyncio.sleep(random.uniform(60, 300))
+        while self.running:
+            try:
+                if self.cache.set_if_not_exists(
+                    "memory_compaction:lock", os.getpid(), ttl=int(self.interval)
+                ):
+                    await self.run_once()
+            except Exception as e:
+                logger.error(f"Memory compaction pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _collections(self) -> List[tuple]:
+        from DB import Memory, get_session
+        from sqlalchemy import func
+
+        session = get_session()
+        try:
+            return (
+                session.query(Memory.agent_id, Memory.conversation_id, func.count())
+                .group_by(Memory.agent_id, Memory.conversation_id)
+                .having(func.count() > 1)
+                .all()
+            )
+        finally:
+            session.close()
+
+    def _compact(self, agent_id, conversation_id, dry_run=False) -> CompactionResult:
+        from DB import Memory, get_session
+
+        session = get_session()
+        try:
+            return compact_collection(
+                session, Memory, agent_id, conversation_id, dry_run=dry_run
+            )
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    async def compact_agent(
+        self, agent_id, conversation_id=None, dry_run: bool = False
+    ) -> CompactionResult:
+        """Compact one collection now (used by the API)"""
+        result = await asyncio.to_thread(
+            self._compact, agent_id, conversation_id, dry_run
+        )
+        if not dry_run:
+            self._record(result)
+        return result
+
+    async def run_once(self) -> CompactionResult:
+        """Compact every collection whose size changed since its last pass"""
+        total = CompactionResult()
+        for agent_id, conversation_id, count in await asyncio.to_thread(
+            self._collections
+        ):
+            key = f"memory_compaction:count:{agent_id}:{conversation_id or '0'}"
+            if self.cache.get(key) == count:
+                continue
+            try:
+                result = await asyncio.to_thread(
+                    self._compact, agent_id, conversation_id
+                )
+            except Exception as e:
+                logger.warning(f"Could not compact memories of agent {agent_id}: {e}")
+                continue
+            total.add(result)
+            self.cache.set(key, result.scanned - result.removed, ttl=7 * 86400)
+        self._record(total)
+        if total.removed:
+            logger.info(
+                f"Memory compaction removed {total.removed} duplicate rows "
+                f"({total.exact_duplicates} exact, {total.near_duplicates} near) "
+                f"out of {total.scanned} scanned in {total.duration:.1f}s"
+            )
+        return total
+
+    def _record(self, result: CompactionResult):
+        self._stats.add(result)
+        self._runs += 1
+        self._last_run = datetime.now().isoformat()
+
+    def get_stats(self) -> dict:
+        stats = self._stats.to_dict()
+        stats.pop("dry_run", None)
+        stats["runs"] = self._runs
+        stats["last_run"] = self._last_run
+        stats["running"] = self.running
+        return stats
+
+
+memory_compaction = MemoryCompactionService()
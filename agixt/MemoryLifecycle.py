@@ -0,0 +1,688 @@
+"""
+MemoryLifecycle - Retention policies for agent memory collections
+
+Conversation collections and web search results otherwise accumulate
+forever, and every retrieval scans all of them. A lifecycle policy bounds a
+collection by:
+
+- `ttl_days`: per `external_source` glob pattern ("http*", "file *", "*"),
+  the days a memory may go unused, counted from when it was written or last
+  retrieved, whichever is later;
+- `max_rows` / `max_bytes`: caps enforced by evicting the least recently
+  retrieved memories first;
+- `archive`: evicted rows are written to the workspace storage container as
+  an NDJSON export (see MemoryTransfer) before they are deleted, so they can
+  be imported back.
+
+Policies are layered: MEMORY_LIFECYCLE_POLICY (server default, empty unless
+the operator sets one), then the agent's `memory_lifecycle_policy` setting.
+Nothing expires or is evicted until one of them asks for it. Each document has a "default"
+section, a "core" (collection 0) or "conversations" section, and
+"collections" keyed by conversation ID:
+
+    {"conversations": {"ttl_days": {"http*": 30}, "max_rows": 5000},
+     "collections": {"<conversation id>": {"max_rows": 20000}}}
+
+Retrieval counts and times are buffered in memory and written in one batched
+UPDATE per flush, so searches never wait on a write.
+"""
+
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+POLICY_SETTING = "memory_lifecycle_policy"
+
+DEFAULT_POLICY_DOCUMENT = json.loads(os.getenv("MEMORY_LIFECYCLE_POLICY") or "{}")
+
+LIFECYCLE_INTERVAL = float(os.getenv("MEMORY_LIFECYCLE_INTERVAL_HOURS", "6")) * 3600
+
+STATS_FLUSH_INTERVAL = float(os.getenv("MEMORY_STATS_FLUSH_SECONDS", "30"))
+
+# Flush early once this many distinct memories are waiting
+STATS_FLUSH_SIZE = 5000
+
+# Stored size of one 384-dimension float32 embedding, counted toward max_bytes
+EMBEDDING_ROW_BYTES = 384 * 4
+
+DELETE_BATCH_SIZE = 500
+
+Archiver = Callable[[str, Optional[str], Iterator[bytes]], str]
+
+
+@dataclass
+class LifecyclePolicy:
+    ttl_days: Dict[str, float] = field(default_factory=dict)
+    max_rows: Optional[int] = None
+    max_bytes: Optional[int] = None
+    archive: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LifecyclePolicy":
+        return cls().merge(data)
+
+    def merge(self, data: Optional[dict]) -> "LifecyclePolicy":
+        """A copy with the keys present in `data` overriding this policy"""
+        if not data:
+            return LifecyclePolicy(**asdict(self))
+        if not isinstance(data, dict):
+            raise ValueError("A memory lifecycle policy must be an object")
+        unknown = set(data) - {"ttl_days", "max_rows", "max_bytes", "archive"}
+        if unknown:
+            raise ValueError(f"Unknown lifecycle policy keys: {sorted(unknown)}")
+        ttl_days = dict(self.ttl_days)
+        for pattern, days in (data.get("ttl_days") or {}).items():
+            ttl_days[str(pattern)] = None if days is None else float(days)
+        ttl_days = {pattern: days for pattern, days in ttl_days.items() if days}
+        merged = LifecyclePolicy(
+            ttl_days=ttl_days,
+            max_rows=self.max_rows,
+            max_bytes=self.max_bytes,
+            archive=bool(data.get("archive", self.archive)),
+        )
+        for cap in ("max_rows", "max_bytes"):
+            if cap in data:
+                value = data[cap]
+                if value is not None and int(value) < 0:
+                    raise ValueError(f"{cap} must not be negative")
+                setattr(merged, cap, None if value is None else int(value))
+        return merged
+
+    @property
+    def enforced(self) -> bool:
+        caps = (self.max_rows, self.max_bytes)
+        return bool(self.ttl_days) or any(cap is not None for cap in caps)
+
+    def ttl_for(self, external_source: Optional[str]) -> Optional[timedelta]:
+        """The longest TTL among the patterns matching the source"""
+        source = external_source or ""
+        days = [
+            value
+            for pattern, value in self.ttl_days.items()
+            if fnmatch.fnmatchcase(source, pattern)
+        ]
+        return timedelta(days=max(days)) if days else None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def resolve_policy(
+    documents: Sequence[Optional[dict]], conversation_id=None
+) -> LifecyclePolicy:
+    """Layer policy documents, later ones overriding earlier ones"""
+    scope = "conversations" if conversation_id else "core"
+    policy = LifecyclePolicy()
+    for document in documents:
+        if not document:
+            continue
+        policy = policy.merge(document.get("default"))
+        policy = policy.merge(document.get(scope))
+        if conversation_id:
+            collections = document.get("collections") or {}
+            policy = policy.merge(collections.get(str(conversation_id)))
+    return policy
+
+
+def validate_policy_document(document: dict):
+    """Raise ValueError if any section of the document is not a valid policy"""
+    if not isinstance(document, dict):
+        raise ValueError("A memory lifecycle policy must be an object")
+    unknown = set(document) - {"default", "core", "conversations", "collections"}
+    if unknown:
+        raise ValueError(f"Unknown lifecycle policy sections: {sorted(unknown)}")
+    for section in ("default", "core", "conversations"):
+        LifecyclePolicy.from_dict(document.get(section))
+    for policy in (document.get("collections") or {}).values():
+        LifecyclePolicy.from_dict(policy)
+
+
+@dataclass
+class LifecyclePlan:
+    expired: List[Any] = field(default_factory=list)
+    evicted: List[Any] = field(default_factory=list)
+    rows: int = 0
+    bytes: int = 0
+    bytes_freed: int = 0
+
+    @property
+    def removed(self) -> List[Any]:
+        return self.expired + self.evicted
+
+
+def row_bytes(row) -> int:
+    return (row.text_length or 0) + EMBEDDING_ROW_BYTES
+
+
+def last_used(row) -> datetime:
+    written = row.timestamp or datetime.min
+    retrieved = row.last_retrieved_at or datetime.min
+    return max(written, retrieved)
+
+
+def plan_lifecycle(
+    rows: Sequence[Any], policy: LifecyclePolicy, now: datetime
+) -> LifecyclePlan:
+    """
+    Decide which rows of one collection to remove.
+
+    Rows need `id`, `external_source`, `timestamp`, `last_retrieved_at` and
+    `text_length`. Expired rows go first; then, while the collection is over
+    a cap, the least recently retrieved rows (never retrieved ones by age).
+    """
+    plan = LifecyclePlan(rows=len(rows), bytes=sum(row_bytes(row) for row in rows))
+    survivors = []
+    for row in rows:
+        ttl = policy.ttl_for(row.external_source)
+        if ttl is not None and now - last_used(row) > ttl:
+            plan.expired.append(row.id)
+            plan.bytes_freed += row_bytes(row)
+        else:
+            survivors.append(row)
+    remaining_rows = len(survivors)
+    remaining_bytes = plan.bytes - plan.bytes_freed
+    if policy.max_rows is None and policy.max_bytes is None:
+        return plan
+    survivors.sort(
+        key=lambda row: (
+            row.last_retrieved_at or datetime.min,
+            row.timestamp or datetime.min,
+        )
+    )
+    for row in survivors:
+        over_rows = policy.max_rows is not None and remaining_rows > policy.max_rows
+        over_bytes = policy.max_bytes is not None and remaining_bytes > policy.max_bytes
+        if not over_rows and not over_bytes:
+            break
+        plan.evicted.append(row.id)
+        plan.bytes_freed += row_bytes(row)
+        remaining_rows -= 1
+        remaining_bytes -= row_bytes(row)
+    return plan
+
+
+@dataclass
+class LifecycleResult:
+    collections: int = 0
+    scanned: int = 0
+    expired: int = 0
+    evicted: int = 0
+    archived: int = 0
+    bytes_freed: int = 0
+    archive_failures: int = 0
+    dry_run: bool = False
+    duration: float = 0.0
+
+    def add(self, other: "LifecycleResult"):
+        for name in (
+            "collections",
+            "scanned",
+            "expired",
+            "evicted",
+            "archived",
+            "bytes_freed",
+            "archive_failures",
+        ):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.duration += other.duration
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class RetrievalStats:
+    """
+    Per-process buffer of memory retrievals. `record` is a dict update on the
+    request path; `flush` writes the counts in one executemany UPDATE.
+    """
+
+    def __init__(self, clock: Callable[[], datetime] = datetime.now):
+        self.clock = clock
+        self._pending: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    def record(self, memory_ids: Iterable[Any]):
+        now = self.clock()
+        with self._lock:
+            for memory_id in memory_ids:
+                entry = self._pending.setdefault(str(memory_id), [0, now])
+                entry[0] += 1
+                entry[1] = now
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self, session, model) -> int:
+        """Apply buffered counts; returns the number of memories updated"""
+        from sqlalchemy import bindparam, func, update
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        table = model.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("memory_id"))
+            .values(
+                retrieval_count=func.coalesce(table.c.retrieval_count, 0)
+                + bindparam("hits"),
+                last_retrieved_at=bindparam("retrieved_at"),
+            )
+        )
+        try:
+            session.execute(
+                statement,
+                [
+                    {"memory_id": memory_id, "hits": hits, "retrieved_at": at}
+                    for memory_id, (hits, at) in pending.items()
+                ],
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for memory_id, (hits, at) in pending.items():
+                    entry = self._pending.setdefault(memory_id, [0, at])
+                    entry[0] += hits
+                    entry[1] = max(entry[1], at)
+            raise
+        return len(pending)
+
+
+def collection_rows(session, model, agent_id, conversation_id=None) -> List[Any]:
+    """The lifecycle columns of one collection, without text or embeddings"""
+    from sqlalchemy import func
+
+    return (
+        session.query(
+            model.id,
+            model.external_source,
+            model.timestamp,
+            model.last_retrieved_at,
+            func.length(model.text).label("text_length"),
+        )
+        .filter(model.agent_id == agent_id, model.conversation_id == conversation_id)
+        .all()
+    )
+
+
+def _archive_rows(session, model, ids: List[Any]) -> Iterator[Any]:
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        yield from session.query(model).filter(
+            model.id.in_(ids[start : start + DELETE_BATCH_SIZE])
+        )
+
+
+def enforce_collection(
+    session,
+    model,
+    agent_id,
+    conversation_id,
+    policy: LifecyclePolicy,
+    now: datetime,
+    archiver: Optional[Archiver] = None,
+    dry_run: bool = False,
+) -> LifecycleResult:
+    """
+    Apply `policy` to one collection. Rows are only deleted once the archive
+    (when the policy asks for one) has been written.
+    """
+    from MemoryTransfer import embedding_model_fingerprint, export_ndjson
+
+    started = time.monotonic()
+    result = LifecycleResult(collections=1, dry_run=dry_run)
+    plan = plan_lifecycle(
+        collection_rows(session, model, agent_id, conversation_id), policy, now
+    )
+    result.scanned = plan.rows
+    result.expired = len(plan.expired)
+    result.evicted = len(plan.evicted)
+    result.bytes_freed = plan.bytes_freed
+    removed = plan.removed
+    if dry_run or not removed:
+        result.duration = time.monotonic() - started
+        return result
+    if policy.archive and archiver is not None:
+        try:
+            archiver(
+                str(agent_id),
+                str(conversation_id) if conversation_id else None,
+                export_ndjson(
+                    _archive_rows(session, model, removed),
+                    fingerprint=embedding_model_fingerprint(),
+                ),
+            )
+            result.archived = len(removed)
+        except Exception as e:
+            logger.error(
+                f"Could not archive {len(removed)} memories of agent {agent_id}; "
+                f"keeping them: {e}"
+            )
+            session.rollback()
+            result.archive_failures = 1
+            result.expired = result.evicted = result.bytes_freed = 0
+            result.duration = time.monotonic() - started
+            return result
+    for start in range(0, len(removed), DELETE_BATCH_SIZE):
+        session.query(model).filter(
+            model.id.in_(removed[start : start + DELETE_BATCH_SIZE])
+        ).delete(synchronize_session=False)
+    session.commit()
+    result.duration = time.monotonic() - started
+    return result
+
+
+def collection_report(
+    session, model, agent_id, documents: Sequence[Optional[dict]], now: datetime
+) -> List[dict]:
+    """Size, age and pending removals of every collection of an agent"""
+    from sqlalchemy import func
+
+    collections = (
+        session.query(model.conversation_id)
+        .filter(model.agent_id == agent_id)
+        .group_by(model.conversation_id)
+        .order_by(func.count().desc())
+        .all()
+    )
+    report = []
+    for (conversation_id,) in collections:
+        rows = collection_rows(session, model, agent_id, conversation_id)
+        policy = resolve_policy(documents, conversation_id)
+        plan = plan_lifecycle(rows, policy, now)
+        timestamps = [row.timestamp for row in rows if row.timestamp]
+        retrieved = [row.last_retrieved_at for row in rows if row.last_retrieved_at]
+        report.append(
+            {
+                "collection": str(conversation_id) if conversation_id else "0",
+                "rows": plan.rows,
+                "bytes": plan.bytes,
+                "never_retrieved": len(rows) - len(retrieved),
+                "oldest": min(timestamps).isoformat() if timestamps else None,
+                "newest": max(timestamps).isoformat() if timestamps else None,
+                "last_retrieved": max(retrieved).isoformat() if retrieved else None,
+                "policy": policy.to_dict(),
+                "pending_expired": len(plan.expired),
+                "pending_evicted": len(plan.evicted),
+            }
+        )
+    return report
+
+
+class WorkspaceArchiver:
+    """Upload archives to memory_archive/ in the agent's workspace storage"""
+
+    def __init__(self):
+        self._manager = None
+
+    def __call__(self, agent_id, conversation_id, lines: Iterator[bytes]) -> str:
+        if self._manager is None:
+            from Workspaces import WorkspaceManager
+
+            self._manager = WorkspaceManager()
+        manager = self._manager
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        object_path = (
+            f"{manager._get_agent_folder_name(agent_id)}/memory_archive/"
+            f"{conversation_id or '0'}/{stamp}.ndjson"
+        )
+        with tempfile.NamedTemporaryFile("wb", suffix=".ndjson", delete=False) as f:
+            for line in lines:
+                f.write(line)
+            path = f.name
+        try:
+            manager.container.upload_object(path, object_path)
+        finally:
+            os.remove(path)
+        return object_path
+
+
+class MemoryLifecycleService:
+    """
+    Enforces lifecycle policies in the background.
+
+    Every worker flushes its own retrieval stats every STATS_FLUSH_INTERVAL;
+    one worker per interval wins a shared-cache lock and enforces policies on
+    every collection.
+    """
+
+    def __init__(
+        self,
+        interval: float = LIFECYCLE_INTERVAL,
+        flush_interval: float = STATS_FLUSH_INTERVAL,
+        cache=None,
+        clock: Callable[[], datetime] = datetime.now,
+        archiver: Optional[Archiver] = None,
+        stats: Optional[RetrievalStats] = None,
+    ):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.cache = cache or shared_cache
+        self.clock = clock
+        self.archiver = archiver or WorkspaceArchiver()
+        self.stats = stats or RetrievalStats(clock)
+        self.running = False
+        self._tasks: List[asyncio.Task] = []
+        self._totals = LifecycleResult()
+        self._runs = 0
+        self._last_run: Optional[str] = None
+
+    async def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._tasks = [asyncio.create_task(self._flush_loop())]
+        if self.interval > 0:
+            self._tasks.append(asyncio.create_task(self._enforce_loop()))
+
+    async def stop(self):
+        self.running = False
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._tasks = []
+        try:
+            await self.flush_stats()
+        except Exception as e:
+            logger.warning(f"Could not flush memory retrieval stats: {e}")
+
+    def record_retrieval(self, memory_ids: Iterable[Any]):
+        self.stats.record(memory_ids)
+
+    async def _flush_loop(self):
+        while self.running:
+            started = time.monotonic()
+            while (
+                self.running
+                and time.monotonic() - started < self.flush_interval
+                and self.stats.pending < STATS_FLUSH_SIZE
+            ):
+                await asyncio.sleep(1)
+            try:
+                await self.flush_stats()
+            except Exception as e:
+                logger.warning(f"Could not flush memory retrieval stats: {e}")
+
+    async def _enforce_loop(self):
+        # Stagger workers so they do not all race for the lock at boot
+        await asyncio.sleep(random.uniform(60, 300))
+        while self.running:
+            try:
+                if self.cache.set_if_not_exists(
+                    "memory_lifecycle:lock", os.getpid(), ttl=int(self.interval)
+                ):
+                    await self.run_once()
+            except Exception as e:
+                logger.error(f"Memory lifecycle pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _session(self):
+        from DB import get_session
+
+        return get_session()
+
+    def _model(self):
+        from DB import Memory
+
+        return Memory
+
+    def _policy_document(self, session, agent_id) -> Optional[dict]:
+        from DB import AgentSetting
+
+        setting = (
+            session.query(AgentSetting.value)
+            .filter(
+                AgentSetting.agent_id == agent_id, AgentSetting.name == POLICY_SETTING
+            )
+            .first()
+        )
+        if not setting or not setting[0]:
+            return None
+        try:
+            document = json.loads(setting[0])
+            validate_policy_document(document)
+            return document
+        except ValueError as e:
+            logger.warning(
+                f"Ignoring invalid memory lifecycle policy of {agent_id}: {e}"
+            )
+            return None
+
+    def _flush(self) -> int:
+        session = self._session()
+        try:
+            return self.stats.flush(session, self._model())
+        finally:
+            session.close()
+
+    async def flush_stats(self) -> int:
+        if not self.stats.pending:
+            return 0
+        return await asyncio.to_thread(self._flush)
+
+    def _enforce(self, agent_id, conversation_id, dry_run) -> LifecycleResult:
+        session = self._session()
+        try:
+            policy = resolve_policy(
+                [DEFAULT_POLICY_DOCUMENT, self._policy_document(session, agent_id)],
+                conversation_id,
+            )
+            if not policy.enforced:
+                return LifecycleResult(dry_run=dry_run)
+            return enforce_collection(
+                session,
+                self._model(),
+                agent_id,
+                conversation_id,
+                policy,
+                self.clock(),
+                archiver=self.archiver,
+                dry_run=dry_run,
+            )
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _collections(self) -> List[tuple]:
+        model = self._model()
+        session = self._session()
+        try:
+            return (
+                session.query(model.agent_id, model.conversation_id)
+                .group_by(model.agent_id, model.conversation_id)
+                .all()
+            )
+        finally:
+            session.close()
+
+    async def enforce_agent(
+        self, agent_id, conversation_id=None, dry_run: bool = False
+    ) -> LifecycleResult:
+        """Apply the policy to one collection now (used by the API)"""
+        await self.flush_stats()
+        result = await asyncio.to_thread(
+            self._enforce, agent_id, conversation_id, dry_run
+        )
+        if not dry_run:
+            self._record(result)
+        return result
+
+    async def run_once(self) -> LifecycleResult:
+        """Apply policies to every collection"""
+        await self.flush_stats()
+        total = LifecycleResult()
+        for agent_id, conversation_id in await asyncio.to_thread(self._collections):
+            try:
+                result = await asyncio.to_thread(
+                    self._enforce, agent_id, conversation_id, False
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Could not apply memory lifecycle policy to agent {agent_id}: {e}"
+                )
+                continue
+            total.add(result)
+        self._record(total)
+        if total.expired or total.evicted:
+            logger.info(
+                f"Memory lifecycle removed {total.expired} expired and "
+                f"{total.evicted} evicted memories ({total.bytes_freed} bytes, "
+                f"{total.archived} archived) in {total.duration:.1f}s"
+            )
+        return total
+
+    def _report(self, agent_id, agent_policy: Optional[dict]) -> List[dict]:
+        session = self._session()
+        try:
+            return collection_report(
+                session,
+                self._model(),
+                agent_id,
+                [DEFAULT_POLICY_DOCUMENT, agent_policy],
+                self.clock(),
+            )
+        finally:
+            session.close()
+
+    async def report(self, agent_id, agent_policy: Optional[dict] = None) -> List[dict]:
+        await self.flush_stats()
+        return await asyncio.to_thread(self._report, agent_id, agent_policy)
+
+    def _record(self, result: LifecycleResult):
+        self._totals.add(result)
+        self._runs += 1
+        self._last_run = datetime.now().isoformat()
+
+    def get_stats(self) -> dict:
+        stats = self._totals.to_dict()
+        stats.pop("dry_run", None)
+        stats["runs"] = self._runs
+        stats["last_run"] = self._last_run
+        stats["running"] = self.running
+        stats["pending_retrievals"] = self.stats.pending
+        return stats
+
+
+memory_lifecycle = MemoryLifecycleService()
@@ -0,0 +1,370 @@
+"""
+MemoryTransfer - Streaming NDJSON export and import of agent memories
+
+An export is one JSON object per line:
+
+    {"type": "header", "format": "agixt-memory", "version": 1, "embedding_model": {...}, ...}
+    {"type": "memory", "collection": "0", "text": "...", "embedding": "<base64 float32>", ...}
+    ...
+    {"type": "footer", "count": 12345}
+
+Vectors travel as base64 little-endian float32, which is exact for the stored
+embeddings and about a third of the size of a JSON float list. The header
+carries a fingerprint of the embedding model; an import whose fingerprint
+matches the local model inserts the vectors as-is, otherwise the text is
+re-embedded in batches. Nothing here holds more than one batch in memory, so
+collections of any size can be moved through a single HTTP stream.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+import numpy as np
+
+from EmbeddingService import embedding_model_file
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = "agixt-memory"
+FORMAT_VERSION = 1
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Rows fetched from the database per round trip while exporting
+EXPORT_BATCH_SIZE = 1000
+
+# Records inserted (and, on model mismatch, embedded) per batch while importing
+IMPORT_BATCH_SIZE = 500
+
+# A single memory line longer than this is rejected rather than buffered
+MAX_LINE_BYTES = 16 * 1024 * 1024
+
+# Errors kept in the import report; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+_fingerprint_cache: Dict[str, dict] = {}
+
+
+def _file_sha256(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def embedding_model_fingerprint(model_dir: Optional[str] = None) -> dict:
+    """
+    Describe the local embedding model used by Memories.embed.
+
+    `id` changes whenever anything that affects the vectors changes: the model
+    name, its dimensions, the tokenizer, the weights (including switching to
+    the quantized variant), or the pooling.
+    """
+    model_dir = model_dir or os.path.join(os.getcwd(), "onnx")
+    model_path = os.path.join(model_dir, embedding_model_file(model_dir))
+    stat_key = model_dir
+    if os.path.exists(model_path):
+        stat = os.stat(model_path)
+        stat_key = f"{model_dir}:{stat.st_size}:{stat.st_mtime_ns}"
+    if stat_key in _fingerprint_cache:
+        return _fingerprint_cache[stat_key]
+    config = {}
+    config_path = os.path.join(model_dir, "config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            config = json.load(f)
+    fingerprint = {
+        "name": config.get("_name_or_path", "unknown"),
+        "dimensions": config.get("hidden_size"),
+        "max_length": 256,
+        "pooling": "mean",
+        "normalized": True,
+        "tokenizer_sha256": _file_sha256(os.path.join(model_dir, "tokenizer.json")),
+        "model_sha256": _file_sha256(model_path),
+    }
+    fingerprint["id"] = hashlib.sha256(
+        json.dumps(fingerprint, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    _fingerprint_cache[stat_key] = fingerprint
+    return fingerprint
+
+
+def encode_embedding(embedding) -> Optional[str]:
+    if embedding is None:
+        return None
+    vector = np.asarray(embedding, dtype="<f4").reshape(-1)
+    return base64.b64encode(vector.tobytes()).decode("ascii")
+
+
+def decode_embedding(value) -> Optional[np.ndarray]:
+    """Accept the base64 float32 form or a plain list of numbers"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype="<f4").astype(np.float32)
+    return np.asarray(value, dtype=np.float32).reshape(-1)
+
+
+def _timestamp(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _line(record: dict) -> bytes:
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def export_ndjson(
+    rows: Iterable[Any],
+    fingerprint: dict,
+    agent_name: str = "",
+    include_embeddings: bool = True,
+) -> Iterator[bytes]:
+    """
+    Encode Memory rows (or objects with the same attributes) as NDJSON lines.
+
+    `rows` is consumed lazily, so a streamed query result is never materialised.
+    """
+    yield _line(
+        {
+            "type": "header",
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "agent_name": agent_name,
+            "exported_at": datetime.now().isoformat(),
+            "embedding_model": fingerprint,
+        }
+    )
+    count = 0
+    for row in rows:
+        record = {
+            "type": "memory",
+            "collection": str(row.conversation_id) if row.conversation_id else "0",
+            "text": row.text,
+            "description": row.description,
+            "external_source_name": row.external_source,
+            "additional_metadata": row.additional_metadata,
+            "timestamp": _timestamp(row.timestamp),
+        }
+        if include_embeddings:
+            record["embedding"] = encode_embedding(row.embedding)
+        yield _line(record)
+        count += 1
+    yield _line({"type": "footer", "count": count})
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+    """Split a byte stream into parsed JSON lines, skipping blank lines"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > MAX_LINE_BYTES:
+            raise ValueError(f"Line {line_number + 1} exceeds {MAX_LINE_BYTES} bytes")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Line {line_number} is not valid JSON: {e}")
+    if buffer.strip():
+        try:
+            yield json.loads(buffer)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_number + 1} is not valid JSON: {e}")
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    reembedded: int = 0
+    skipped: int = 0
+    duplicates: int = 0
+    model_match: bool = False
+    source_model: Optional[dict] = None
+    expected_count: Optional[int] = None
+    errors: List[str] = field(default_factory=list)
+    error_count: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.expected_count is not None and self.expected_count == (
+            self.imported + self.skipped + self.duplicates
+        )
+
+    def add_error(self, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["complete"] = self.complete
+        return data
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def import_ndjson(
+    records: AsyncIterable[dict],
+    fingerprint: dict,
+    insert_rows: Callable[[List[dict]], None],
+    embed_texts: Callable[[List[str]], List],
+    resolve_collection: Optional[Callable[[str], Any]] = None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> ImportReport:
+    """
+    Load an export produced by export_ndjson.
+
+    Args:
+        records: Parsed lines, header first (see iter_ndjson)
+        fingerprint: The local embedding model fingerprint
+        insert_rows: Bulk insert for a batch of Memory column dicts; may
+            return how many were inserted when it skips duplicates
+        embed_texts: Embeds a batch of texts with the local model
+        resolve_collection: Maps an exported collection id to the local
+            conversation_id (None for core memories), or raises LookupError
+            to skip records from collections that do not exist here
+        batch_size: Records per insert
+
+    Returns:
+        ImportReport with counts, the source model and any errors
+    """
+    report = ImportReport()
+    dimensions = fingerprint.get("dimensions")
+    resolved: Dict[str, Any] = {}
+    batch: List[dict] = []
+    to_embed: List[dict] = []
+    header_seen = False
+
+    async def flush():
+        if to_embed:
+            vectors = await asyncio.to_thread(
+                embed_texts, [row["text"] for row in to_embed]
+            )
+            for row, vector in zip(to_embed, vectors):
+                row["embedding"] = np.asarray(vector, dtype=np.float32).reshape(-1)
+            report.reembedded += len(to_embed)
+            to_embed.clear()
+        if batch:
+            inserted = await asyncio.to_thread(insert_rows, list(batch))
+            # insert_rows may report fewer rows when it skips duplicates
+            inserted = len(batch) if inserted is None else inserted
+            report.imported += inserted
+            report.duplicates += len(batch) - inserted
+            batch.clear()
+
+    async for record in records:
+        kind = record.get("type")
+        if not header_seen:
+            if kind != "header" or record.get("format") != FORMAT_NAME:
+                raise ValueError("Not an AGiXT memory export: missing header line")
+            if record.get("version", 0) > FORMAT_VERSION:
+                raise ValueError(
+                    f"Export version {record.get('version')} is newer than "
+                    f"supported version {FORMAT_VERSION}"
+                )
+            header_seen = True
+            report.source_model = record.get("embedding_model")
+            report.model_match = bool(
+                report.source_model
+                and report.source_model.get("id") == fingerprint.get("id")
+            )
+            if not report.model_match:
+                logger.info(
+                    "Memory import embedding model differs from the local model, "
+                    "text will be re-embedded"
+                )
+            continue
+        if kind == "footer":
+            report.expected_count = record.get("count")
+            continue
+        if kind != "memory":
+            continue
+        text = record.get("text")
+        if not text:
+            report.skipped += 1
+            report.add_error("Memory without text skipped")
+            continue
+        collection = str(record.get("collection") or "0")
+        if collection not in resolved:
+            try:
+                resolved[collection] = (
+                    resolve_collection(collection)
+                    if resolve_collection
+                    else (None if collection == "0" else collection)
+                )
+            except LookupError as e:
+                resolved[collection] = LookupError(str(e))
+                report.add_error(str(e))
+        conversation_id = resolved[collection]
+        if isinstance(conversation_id, LookupError):
+            report.skipped += 1
+            continue
+        row = {
+            "conversation_id": conversation_id,
+            "text": text,
+            "description": record.get("description"),
+            "external_source": record.get("external_source_name") or "user input",
+            "additional_metadata": record.get("additional_metadata"),
+        }
+        timestamp = _parse_timestamp(record.get("timestamp"))
+        if timestamp:
+            row["timestamp"] = timestamp
+        embedding = None
+        if report.model_match:
+            try:
+                embedding = decode_embedding(record.get("embedding"))
+            except (ValueError, TypeError) as e:
+                report.add_error(f"Unreadable embedding, re-embedding: {e}")
+            if embedding is not None and dimensions and embedding.size != dimensions:
+                report.add_error(
+                    f"Embedding has {embedding.size} dimensions, expected "
+                    f"{dimensions}; re-embedding"
+                )
+                embedding = None
+        if embedding is None:
+            to_embed.append(row)
+        else:
+            row["embedding"] = embedding
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await flush()
+    if not header_seen:
+        raise ValueError("Not an AGiXT memory export: the stream was empty")
+    await flush()
+    if report.expected_count is None:
+        report.add_error("Export has no footer line; it may be truncated")
+    return report
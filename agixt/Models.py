@@ -157,6 +157,19 @@ class AgentPrompt(BaseModel):
     prompt_args: dict
 
 
+class BatchInferenceRequest(BaseModel):
+    user_inputs: List[str]
+    prompt_name: str = "Custom Input"
+    prompt_category: str = "Default"
+    prompt_args: Dict[str, Any] = {}
+    concurrency: int = Field(default=5, ge=1, le=50)
+    timeout: Optional[float] = Field(default=None, gt=0)
+    retries: int = Field(default=0, ge=0, le=5)
+    raw_prompts: bool = False
+    provider_batching: bool = False
+    provider_batch_size: int = Field(default=16, ge=1, le=1000)
+
+
 class ThinkingPrompt(BaseModel):
     user_input: str
     agent_name: str
@@ -168,6 +181,13 @@ class AgentMemoryQuery(BaseModel):
     user_input: str
     limit: int = 5
     min_relevance_score: float = 0.0
+    external_sources: Optional[List[str]] = None
+    external_source_prefix: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    hybrid: Optional[bool] = None
+    rerank: Optional[bool] = None
+    token_budget: Optional[int] = None
 
 
 class UserInput(BaseModel):
@@ -351,6 +371,8 @@ class ImageCreation(BaseModel):
 class EmbeddingModel(BaseModel):
     input: Union[str, List[str]]
     model: str
+    encoding_format: Optional[str] = "float"
+    dimensions: Optional[int] = None
     user: Optional[str] = None
 
 
@@ -746,6 +768,44 @@ class AgentPromptResponse(BaseModel):
     response: str
 
 
+class BatchItemResultResponse(BaseModel):
+    index: int
+    input: Any
+    output: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    duration: float = 0.0
+
+
+class BatchJobResponse(BaseModel):
+    id: str
+    status: str
+    total: int
+    completed: int = 0
+    failed: int = 0
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    results: Optional[List[BatchItemResultResponse]] = None
+    metadata: Dict[str, Any] = {}
+
+
+class IngestionJobResponse(BaseModel):
+    id: str
+    file_name: str
+    status: str
+    stage: str
+    done: int = 0
+    total: int = 0
+    message: Optional[str] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    metadata: Dict[str, Any] = {}
+
+
 class ChainStepDetail(BaseModel):
     step: int
     agent_name: str
@@ -875,7 +935,7 @@ class ChatCompletionChunk(BaseModel):
 
 
 class EmbeddingData(BaseModel):
-    embedding: List[float]
+    embedding: Union[List[float], str]
     index: int
     object: str = "embedding"
 
@@ -933,6 +993,65 @@ class MemoryCollectionResponse(BaseModel):
     external_sources: List[str]
 
 
+class MemoryImportResponse(BaseModel):
+    imported: int
+    reembedded: int
+    skipped: int
+    duplicates: int = 0
+    model_match: bool
+    source_model: Optional[Dict[str, Any]] = None
+    expected_count: Optional[int] = None
+    complete: bool
+    errors: List[str] = []
+    error_count: int = 0
+
+
+class MemoryCompactionResponse(BaseModel):
+    scanned: int
+    exact_duplicates: int
+    near_duplicates: int
+    removed: int
+    merged_groups: int
+    hashes_backfilled: int
+    near_duplicate_scan_skipped: bool
+    dry_run: bool
+    duration: float
+
+
+class MemoryLifecyclePolicyInput(BaseModel):
+    policy: Dict[str, Any]
+
+
+class MemoryLifecycleCollection(BaseModel):
+    collection: str
+    rows: int
+    bytes: int
+    never_retrieved: int
+    oldest: Optional[str] = None
+    newest: Optional[str] = None
+    last_retrieved: Optional[str] = None
+    policy: Dict[str, Any]
+    pending_expired: int
+    pending_evicted: int
+
+
+class MemoryLifecycleReportResponse(BaseModel):
+    policy: Optional[Dict[str, Any]] = None
+    collections: List[MemoryLifecycleCollection]
+
+
+class MemoryLifecycleResponse(BaseModel):
+    collections: int
+    scanned: int
+    expired: int
+    evicted: int
+    archived: int
+    bytes_freed: int
+    archive_failures: int
+    dry_run: bool
+    duration: float
+
+
 class DPOResponse(BaseModel):
     prompt: str
     chosen: str
@@ -0,0 +1,416 @@
+"""
+Reranker - Second-stage scoring of retrieved memories
+
+Vector and hybrid search score the query and each memory separately, so the
+top results are often only loosely on topic. This module re-scores a small
+pool of candidates by looking at the query and each memory together. It then
+keeps the best ones that fit a token budget, so the prompt spends its context
+on what answers the question.
+
+- `CrossEncoderScorer` runs an ONNX cross-encoder, such as
+  cross-encoder/ms-marco-MiniLM-L-6-v2 exported with `optimum`, from
+  RERANKER_MODEL_DIR. It needs model.onnx and tokenizer.json there.
+- `LexicalScorer` is the fallback when no model is installed. It combines
+  BM25 over the candidate pool with query-term coverage. Because it cannot
+  see meaning, its ranking is fused with the first-stage order instead of
+  replacing it.
+
+Cross-encoder scores are cached in SharedCache by model, query hash and
+memory id, so follow-up turns that ask the same question skip inference.
+
+    from Reranker import memory_reranker
+    results = memory_reranker.rerank(query, [(memory_id, text), ...], limit=5,
+                                     token_budget=2000)
+"""
+
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from EmbeddingService import default_intra_op_threads
+from HybridRetrieval import query_terms, reciprocal_rank_fusion
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+RERANKER_MODEL_DIR = os.getenv(
+    "RERANKER_MODEL_DIR", os.path.join(os.getcwd(), "reranker")
+)
+
+# First-stage candidates rescored per query
+RERANK_CANDIDATES = int(os.getenv("MEMORY_RERANK_CANDIDATES", "40"))
+
+# Query plus memory tokens per pair; longer memories are truncated
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", "256"))
+
+# Pairs per ONNX forward pass
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+
+RERANK_CACHE_TTL = int(os.getenv("RERANK_CACHE_TTL", "3600"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_PATTERN = re.compile(r"\w+(?:[-.:/]\w+)*")
+
+
+def query_digest(query: str) -> str:
+    return hashlib.sha256(query.strip().lower().encode("utf-8")).hexdigest()[:24]
+
+
+def _document_terms(text: str) -> List[str]:
+    """Lowercased words, with compound identifiers also split into their parts"""
+    terms = []
+    for match in _WORD_PATTERN.finditer(text.lower()):
+        term = match.group(0)
+        terms.append(term)
+        if not term.isalnum():
+            terms.extend(part for part in re.split(r"[-.:/_]", term) if part)
+    return terms
+
+
+class LexicalScorer:
+    """BM25 over the candidate pool, scaled by the share of query terms matched"""
+
+    name = "lexical"
+    cacheable = False
+    # Fuse with the first-stage order instead of replacing it
+    blend_with_prior = True
+
+    def __call__(self, query: str, texts: Sequence[str]) -> List[float]:
+        terms = query_terms(query)
+        if not terms or not texts:
+            return [0.0] * len(texts)
+        documents = [Counter(_document_terms(text)) for text in texts]
+        lengths = [sum(document.values()) for document in documents]
+        average_length = (sum(lengths) / len(lengths)) or 1.0
+        frequencies = {
+            term: sum(1 for document in documents if term in document) for term in terms
+        }
+        scores = []
+        for document, length in zip(documents, lengths):
+            score = 0.0
+            matched = 0
+            for term in terms:
+                count = document.get(term, 0)
+                if not count:
+                    continue
+                matched += 1
+                df = frequencies[term]
+                idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+                score += idf * (
+                    count
+                    * (BM25_K1 + 1)
+                    / (
+                        count
+                        + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    )
+                )
+            scores.append(score * matched / len(terms))
+        return scores
+
+
+class CrossEncoderScorer:
+    """
+    Relevance logits from an ONNX cross-encoder, loaded on first use.
+
+    Pairs are sorted by token length and each batch is padded only to its
+    longest member, as in OnnxEmbedder.
+    """
+
+    cacheable = True
+    blend_with_prior = False
+
+    def __init__(
+        self,
+        model_dir: Optional[str] = None,
+        max_length: int = RERANKER_MAX_LENGTH,
+        batch_size: int = RERANKER_BATCH_SIZE,
+        intra_op_threads: Optional[int] = None,
+    ):
+        self.model_dir = model_dir or RERANKER_MODEL_DIR
+        self.max_length = max_length
+        self.batch_size = max(1, batch_size)
+        self.intra_op_threads = intra_op_threads or default_intra_op_threads()
+        self._tokenizer = None
+        self._model = None
+        self._input_names = ()
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return all(
+            os.path.exists(os.path.join(self.model_dir, name))
+            for name in ("model.onnx", "tokenizer.json")
+        )
+
+    @property
+    def name(self) -> str:
+        # Replacing the model file changes the name, which retires cached scores
+        stat = os.stat(os.path.join(self.model_dir, "model.onnx"))
+        return f"cross-encoder:{stat.st_size:x}{stat.st_mtime_ns:x}"
+
+    def _load(self):
+        with self._lock:
+            if self._model is not None:
+                return
+            from onnxruntime import (
+                ExecutionMode,
+                GraphOptimizationLevel,
+                InferenceSession,
+                SessionOptions,
+            )
+            from tokenizers import Tokenizer
+
+            tokenizer = Tokenizer.from_file(
+                os.path.join(self.model_dir, "tokenizer.json")
+            )
+            tokenizer.enable_truncation(max_length=self.max_length)
+            tokenizer.no_padding()
+            options = SessionOptions()
+            options.intra_op_num_threads = self.intra_op_threads
+            options.inter_op_num_threads = 1
+            options.execution_mode = ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._tokenizer = tokenizer
+            self._model = InferenceSession(
+                os.path.join(self.model_dir, "model.onnx"),
+                sess_options=options,
+                providers=["CPUExecutionProvider"],
+            )
+            self._input_names = {
+                model_input.name for model_input in self._model.get_inputs()
+            }
+            logger.info(
+                f"Loaded reranker model from {self.model_dir} with "
+                f"{self.intra_op_threads} intra-op threads"
+            )
+
+    def _score_batch(self, encoded) -> np.ndarray:
+        length = max(len(encoding.ids) for encoding in encoded)
+        arrays = {
+            name: np.zeros((len(encoded), length), dtype=np.int64)
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+        }
+        for row, encoding in enumerate(encoded):
+            size = len(encoding.ids)
+            arrays["input_ids"][row, :size] = encoding.ids
+            arrays["attention_mask"][row, :size] = 1
+            arrays["token_type_ids"][row, :size] = encoding.type_ids
+        logits = self._model.run(
+            None,
+            {
+                name: value
+                for name, value in arrays.items()
+                if name in self._input_names
+            },
+        )[0]
+        logits = np.asarray(logits, dtype=np.float32)
+        if logits.ndim == 2 and logits.shape[1] == 2:
+            # Two-class heads: the margin of "relevant" over "not relevant"
+            return logits[:, 1] - logits[:, 0]
+        return logits.reshape(len(encoded), -1)[:, 0]
+
+    def __call__(self, query: str, texts: Sequence[str]) -> List[float]:
+        if not texts:
+            return []
+        if self._model is None:
+            self._load()
+        encoded = self._tokenizer.encode_batch([(query, text) for text in texts])
+        order = sorted(range(len(texts)), key=lambda index: len(encoded[index].ids))
+        scores = [0.0] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            for index, score in zip(
+                batch, self._score_batch([encoded[index] for index in batch])
+            ):
+                scores[index] = float(score)
+        return scores
+
+
+@dataclass
+class RerankResult:
+    key: str
+    score: float
+    # Position in the first-stage ranking, starting at 0
+    prior_rank: int
+    tokens: Optional[int] = None
+
+
+def select_within_budget(
+    results: Sequence[RerankResult],
+    texts: Dict[str, str],
+    limit: Optional[int] = None,
+    token_budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> List[RerankResult]:
+    """
+    Take results best first until `limit` is reached or the budget is spent.
+    A result too large for what is left is skipped, so a smaller one further
+    down can still fit.
+    """
+    selected = []
+    remaining = token_budget
+    for result in results:
+        if limit is not None and len(selected) >= limit:
+            break
+        if remaining is not None:
+            if remaining <= 0:
+                break
+            if result.tokens is None:
+                result.tokens = count_tokens(texts[result.key])
+            if result.tokens > remaining:
+                continue
+            remaining -= result.tokens
+        selected.append(result)
+    return selected
+
+
+def _default_count_tokens(text: str) -> int:
+    from Globals import get_tokens
+
+    return get_tokens(text)
+
+
+class Reranker:
+    """Rescore first-stage candidates and pick a token-budgeted selection"""
+
+    def __init__(
+        self,
+        scorer=None,
+        cache=None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        fallback=None,
+    ):
+        self._scorer = scorer
+        self.fallback = fallback or LexicalScorer()
+        self.cache = cache or shared_cache
+        self.count_tokens = count_tokens or _default_count_tokens
+        self.stats = {
+            "queries": 0,
+            "candidates": 0,
+            "scored": 0,
+            "cache_hits": 0,
+            "fallbacks": 0,
+            "scoring_seconds": 0.0,
+        }
+
+    @property
+    def scorer(self):
+        if self._scorer is None:
+            model = CrossEncoderScorer()
+            if model.available:
+                self._scorer = model
+            else:
+                logger.info(
+                    f"No reranker model in {model.model_dir}; "
+                    "reranking memories lexically"
+                )
+                self._scorer = self.fallback
+        return self._scorer
+
+    def _cache_key(self, scorer_name: str, digest: str, key: str) -> str:
+        return f"rerank:{scorer_name}:{digest}:{key}"
+
+    def _score(self, scorer, query: str, candidates: Sequence[Tuple[str, str]]):
+        if not scorer.cacheable:
+            return scorer(query, [text for _, text in candidates])
+        name = scorer.name
+        digest = query_digest(query)
+        scores: List[Optional[float]] = []
+        missing = []
+        for index, (key, _) in enumerate(candidates):
+            cached = self.cache.get(self._cache_key(name, digest, key))
+            scores.append(cached)
+            if cached is None:
+                missing.append(index)
+            else:
+                self.stats["cache_hits"] += 1
+        if missing:
+            fresh = scorer(query, [candidates[index][1] for index in missing])
+            for index, score in zip(missing, fresh):
+                scores[index] = score
+                self.cache.set(
+                    self._cache_key(name, digest, candidates[index][0]),
+                    score,
+                    ttl=RERANK_CACHE_TTL,
+                )
+        return scores
+
+    def rerank(
+        self,
+        query: str,
+        candidates: Sequence[Tuple[str, str]],
+        limit: Optional[int] = None,
+        token_budget: Optional[int] = None,
+    ) -> List[RerankResult]:
+        """
+        Args:
+            query: The user input the memories should answer
+            candidates: (key, text) pairs in first-stage order, best first
+            limit: Most results to return
+            token_budget: Most tokens of text to return, counted with
+                count_tokens; None for no budget
+
+        Returns:
+            RerankResults best first. Scores are model logits, or fused rank
+            scores for the lexical fallback, and only comparable within a call.
+        """
+        candidates = list(candidates)
+        self.stats["queries"] += 1
+        self.stats["candidates"] += len(candidates)
+        if not candidates:
+            return []
+        scorer = self.scorer
+        start = time.perf_counter()
+        try:
+            scores = self._score(scorer, query, candidates)
+        except Exception as e:
+            logger.warning(f"Reranker failed, falling back to lexical scores: {e}")
+            self.stats["fallbacks"] += 1
+            scorer = self.fallback
+            scores = self._score(scorer, query, candidates)
+        self.stats["scoring_seconds"] += time.perf_counter() - start
+        self.stats["scored"] += len(candidates)
+        if scorer.blend_with_prior:
+            lexical = sorted(
+                (index for index, score in enumerate(scores) if score > 0),
+                key=lambda index: scores[index],
+                reverse=True,
+            )
+            fused = reciprocal_rank_fusion([list(range(len(candidates))), lexical])
+            results = [
+                RerankResult(key=candidates[index][0], score=score, prior_rank=index)
+                for index, score in fused
+            ]
+        else:
+            order = sorted(
+                range(len(candidates)), key=lambda index: scores[index], reverse=True
+            )
+            results = [
+                RerankResult(
+                    key=candidates[index][0],
+                    score=float(scores[index]),
+                    prior_rank=index,
+                )
+                for index in order
+            ]
+        return select_within_budget(
+            results,
+            dict(candidates),
+            limit=limit,
+            token_budget=token_budget,
+            count_tokens=self.count_tokens,
+        )
+
+
+memory_reranker = Reranker()
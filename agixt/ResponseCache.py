@@ -524,7 +524,8 @@ def extract_user_id(request: Request) -> Optional[str]:
     try:
         from MagicalAuth import verify_api_key
 
-        user = verify_api_key(authorization=token)
+        # Shares the resolved AuthContext with the endpoint's dependencies
+        user = verify_api_key(authorization=token, request=request)
         if isinstance(user, dict):
             user_id = user.get("id")
             return str(user_id) if user_id else None
@@ -0,0 +1,567 @@
+"""
+SemanticCodeIndex - Embedding-backed code search for workspaces
+
+The "Semantic Code Search" command used to score whole files by counting
+keyword and synonym hits, so agents regularly pulled irrelevant files into
+context. This module adds a vector index on top of the workspace CodeIndex:
+
+- Source files are chunked along function/class boundaries (``ast`` for
+  Python, the CodeIndex symbol heuristics for other languages, fixed line
+  windows for everything else).
+- Chunks are embedded in batches with the same ONNX embedder used for agent
+  memories (``Memories.embed``). Vectors are cached by chunk content hash, so
+  an edited file only re-embeds the chunks that actually changed and
+  identical chunks are shared between workspaces.
+- Queries combine cosine similarity with the existing keyword/synonym score.
+
+Usage:
+    from SemanticCodeIndex import get_semantic_code_index
+
+    index = get_semantic_code_index(working_directory)
+    for hit in index.search("where are JWT tokens validated", max_results=10):
+        print(hit.chunk.rel_path, hit.chunk.start_line, hit.score)
+"""
+
+import ast
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from CodeIndex import CodeIndex, get_code_index, matches_glob, split_lines
+
+logger = logging.getLogger(__name__)
+
+# Files that are worth embedding; everything else stays keyword-only
+CODE_EXTENSIONS = {
+    ".py",
+    ".js",
+    ".jsx",
+    ".ts",
+    ".tsx",
+    ".mjs",
+    ".cjs",
+    ".vue",
+    ".svelte",
+    ".go",
+    ".rs",
+    ".rb",
+    ".java",
+    ".kt",
+    ".cs",
+    ".swift",
+    ".scala",
+    ".php",
+    ".c",
+    ".h",
+    ".cpp",
+    ".hpp",
+    ".cc",
+    ".sh",
+    ".sql",
+    ".md",
+    ".txt",
+    ".yaml",
+    ".yml",
+    ".toml",
+    ".json",
+}
+
+SKIP_DIRS = {"node_modules", "__pycache__", "venv", ".venv", "dist", "build"}
+
+# Chunking limits (lines)
+MAX_CHUNK_LINES = 80
+WINDOW_LINES = 40
+
+# Embedding batch size; matches the ONNX embedder's internal batch size
+EMBED_BATCH_SIZE = 32
+
+# Seconds to serve keyword-only results after an embedding failure before
+# the embedder is tried again
+EMBEDDING_RETRY_SECONDS = float(os.getenv("SEMANTIC_CODE_EMBEDDING_RETRY", "60"))
+
+# Weight of the vector score in the hybrid ranking (keyword gets the rest)
+VECTOR_WEIGHT = 0.7
+
+# Bound on cached chunk vectors shared across workspaces
+MAX_CACHED_VECTORS = 200_000
+MAX_CACHED_INDEXES = 16
+
+# Programming synonyms used to expand natural language queries
+SYNONYMS = {
+    "auth": [
+        "authenticate",
+        "authentication",
+        "login",
+        "logout",
+        "session",
+        "token",
+        "jwt",
+        "oauth",
+    ],
+    "database": [
+        "db",
+        "sql",
+        "query",
+        "connection",
+        "cursor",
+        "orm",
+        "model",
+    ],
+    "error": [
+        "exception",
+        "try",
+        "except",
+        "catch",
+        "raise",
+        "throw",
+        "error",
+    ],
+    "config": [
+        "configuration",
+        "settings",
+        "env",
+        "environment",
+        "options",
+    ],
+    "api": ["endpoint", "route", "request", "response", "rest", "http"],
+    "test": ["unittest", "pytest", "assert", "mock", "fixture"],
+    "log": ["logging", "logger", "debug", "info", "warning", "error"],
+    "file": ["read", "write", "open", "path", "directory", "folder"],
+    "user": ["account", "profile", "member", "customer"],
+    "data": ["parse", "serialize", "json", "xml", "csv"],
+}
+
+
+@dataclass
+class CodeChunk:
+    """A contiguous region of a source file that is embedded as one unit"""
+
+    rel_path: str
+    start_line: int
+    end_line: int
+    name: str
+    kind: str
+    text: str
+
+    @property
+    def content_hash(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8", "ignore")).hexdigest()
+
+
+@dataclass
+class SearchHit:
+    chunk: CodeChunk
+    score: float
+    vector_score: float
+    keyword_score: float
+
+
+def expand_query_terms(query: str) -> List[str]:
+    """Split a natural language query into terms plus programming synonyms."""
+    words = re.findall(r"\b\w+\b", query.lower())
+    terms = list(words)
+    for word in words:
+        for key, values in SYNONYMS.items():
+            if word == key or word in values:
+                terms.extend(values)
+                terms.append(key)
+    return list(dict.fromkeys(terms))
+
+
+def keyword_score(terms: Sequence[str], text: str) -> int:
+    text_lower = text.lower()
+    return sum(text_lower.count(term) for term in terms)
+
+
+def _window_chunks(rel_path: str, lines: List[str], start: int, end: int):
+    """Fixed-size line windows over ``lines[start:end]`` (0-based, exclusive)."""
+    chunks = []
+    for window_start in range(start, end, WINDOW_LINES):
+        window_end = min(end, window_start + WINDOW_LINES)
+        text = "".join(lines[window_start:window_end])
+        if text.strip():
+            chunks.append(
+                CodeChunk(
+                    rel_path=rel_path,
+                    start_line=window_start + 1,
+                    end_line=window_end,
+                    name="",
+                    kind="block",
+                    text=text,
+                )
+            )
+    return chunks
+
+
+def _python_boundaries(content: str) -> Optional[List[Tuple[int, int, str, str]]]:
+    """``(start, end, name, kind)`` 1-based spans of top-level defs and methods."""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return None
+    spans = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min(
+                [node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]
+            )
+            end = getattr(node, "end_lineno", None) or node.lineno
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            if kind == "class" and end - start + 1 > MAX_CHUNK_LINES:
+                # Large classes are split into their methods, with the class
+                # header (docstring, attributes) as its own chunk.
+                methods = [
+                    n
+                    for n in node.body
+                    if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))
+                ]
+                header_end = end
+                if methods:
+                    first = methods[0]
+                    header_end = (
+                        min([first.lineno] + [d.lineno for d in first.decorator_list])
+                        - 1
+                    )
+                spans.append((start, header_end, node.name, "class"))
+                for method in methods:
+                    m_start = min(
+                        [method.lineno] + [d.lineno for d in method.decorator_list]
+                    )
+                    spans.append(
+                        (
+                            m_start,
+                            method.end_lineno or method.lineno,
+                            f"{node.name}.{method.name}",
+                            "method",
+                        )
+                    )
+            else:
+                spans.append((start, end, node.name, kind))
+    return spans
+
+
+def chunk_source(
+    rel_path: str, content: str, symbols: Optional[List[Tuple[str, int, str]]] = None
+) -> List[CodeChunk]:
+    """
+    Split a file into chunks along function/class boundaries.
+
+    Python uses ``ast`` spans; other languages use the symbol lines reported by
+    the CodeIndex heuristics as chunk starts. Code between definitions (imports,
+    module constants) and oversized definitions fall back to line windows.
+    """
+    lines = split_lines(content)
+    if not lines:
+        return []
+    spans = None
+    if rel_path.endswith(".py"):
+        spans = _python_boundaries(content)
+    if spans is None and symbols:
+        starts = sorted({line for _, line, kind in symbols if kind != "variable"})
+        names = {line: name for name, line, _ in symbols}
+        spans = []
+        for i, start in enumerate(starts):
+            end = (starts[i + 1] - 1) if i + 1 < len(starts) else len(lines)
+            spans.append((start, end, names.get(start, ""), "definition"))
+    if not spans:
+        return _window_chunks(rel_path, lines, 0, len(lines))
+
+    chunks = []
+    cursor = 0  # 0-based index of the first line not yet covered
+    for start, end, name, kind in spans:
+        if start - 1 > cursor:
+            chunks.extend(_window_chunks(rel_path, lines, cursor, start - 1))
+        if end - start + 1 > MAX_CHUNK_LINES:
+            for chunk in _window_chunks(rel_path, lines, start - 1, end):
+                chunk.name, chunk.kind = name, kind
+                chunks.append(chunk)
+        else:
+            chunks.append(
+                CodeChunk(
+                    rel_path=rel_path,
+                    start_line=start,
+                    end_line=end,
+                    name=name,
+                    kind=kind,
+                    text="".join(lines[start - 1 : end]),
+                )
+            )
+        cursor = max(cursor, end)
+    if cursor < len(lines):
+        chunks.extend(_window_chunks(rel_path, lines, cursor, len(lines)))
+    return chunks
+
+
+def _default_embedder(texts: List[str]) -> List[Sequence[float]]:
+    from Memories import embed
+
+    return embed(texts)
+
+
+class _VectorCache:
+    """Content-hash -> vector LRU shared by every workspace index."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is not None:
+                self._items.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._items[key] = vector
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+_vector_cache = _VectorCache(MAX_CACHED_VECTORS)
+
+
+class SemanticCodeIndex:
+    """
+    Chunk-level vector index for one workspace.
+
+    ``refresh()`` piggybacks on the CodeIndex stat pass: files whose mtime or
+    size changed are re-chunked and only chunks with new content hashes are
+    sent to the embedder.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        embedder: Optional[Callable[[List[str]], List[Sequence[float]]]] = None,
+        code_index: Optional[CodeIndex] = None,
+    ):
+        self.root = os.path.realpath(root)
+        self.embedder = embedder or _default_embedder
+        self.code_index = code_index or get_code_index(self.root)
+        self._lock = threading.RLock()
+        self._file_versions: Dict[str, Tuple[int, int]] = {}
+        self._file_chunks: Dict[str, List[CodeChunk]] = {}
+        self._chunks: List[CodeChunk] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._dirty = True
+        self.embedding_error: Optional[str] = None
+        self._embedding_failed_at = 0.0
+        self.stats = {
+            "refreshes": 0,
+            "files_chunked": 0,
+            "chunks_embedded": 0,
+            "chunks_reused": 0,
+            "last_refresh_seconds": 0.0,
+        }
+
+    @staticmethod
+    def _eligible(rel_path: str) -> bool:
+        if os.path.splitext(rel_path)[1].lower() not in CODE_EXTENSIONS:
+            return False
+        directories = rel_path.split("/")[:-1]
+        return not any(d.startswith(".") or d in SKIP_DIRS for d in directories)
+
+    def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        vectors = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = self.embedder(texts[i : i + EMBED_BATCH_SIZE])
+            for vector in batch:
+                vector = np.asarray(vector, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                vectors.append(vector / norm if norm else vector)
+        return vectors
+
+    def _embedding_failed(self, error: Exception) -> None:
+        logger.warning(f"SemanticCodeIndex: embedding unavailable: {error}")
+        self.embedding_error = str(error)
+        self._embedding_failed_at = time.monotonic()
+
+    def refresh(self) -> None:
+        """Re-chunk changed files and embed chunks that are not cached yet."""
+        start = time.perf_counter()
+        with self._lock:
+            if (
+                self.embedding_error is not None
+                and time.monotonic() - self._embedding_failed_at
+                >= EMBEDDING_RETRY_SECONDS
+            ):
+                # Try the embedder again; the rebuild embeds whatever chunks
+                # were skipped while it was failing
+                self.embedding_error = None
+                self._dirty = True
+            files = [
+                f
+                for f in self.code_index.candidate_files(refresh=True)
+                if self._eligible(f)
+            ]
+            current = set(files)
+            for rel_path in list(self._file_chunks):
+                if rel_path not in current:
+                    del self._file_chunks[rel_path]
+                    self._file_versions.pop(rel_path, None)
+                    self._dirty = True
+
+            pending: Dict[str, str] = {}
+            for rel_path in files:
+                version = self.code_index.get_version(rel_path)
+                if version is None or self._file_versions.get(rel_path) == version:
+                    continue
+                try:
+                    content = self.code_index.get_text(rel_path)
+                except OSError:
+                    continue
+                chunks = chunk_source(
+                    rel_path, content, self.code_index.get_symbols(rel_path)
+                )
+                self._file_chunks[rel_path] = chunks
+                self._file_versions[rel_path] = version
+                self.stats["files_chunked"] += 1
+                self._dirty = True
+                for chunk in chunks:
+                    key = chunk.content_hash
+                    if _vector_cache.get(key) is None:
+                        pending[key] = chunk.text
+                    else:
+                        self.stats["chunks_reused"] += 1
+
+            if pending and self.embedding_error is None:
+                keys = list(pending)
+                try:
+                    vectors = self._embed([pending[k] for k in keys])
+                except Exception as e:
+                    # No model available (e.g. ONNX weights missing): keep
+                    # serving keyword-ranked chunks instead of failing the search
+                    self._embedding_failed(e)
+                else:
+                    for key, vector in zip(keys, vectors):
+                        _vector_cache.put(key, vector)
+                    self.stats["chunks_embedded"] += len(keys)
+
+            if self._dirty:
+                self._rebuild_matrix()
+            self.stats["refreshes"] += 1
+            self.stats["last_refresh_seconds"] = time.perf_counter() - start
+
+    def _rebuild_matrix(self) -> None:
+        self._chunks = [
+            chunk
+            for rel_path in sorted(self._file_chunks)
+            for chunk in self._file_chunks[rel_path]
+        ]
+        self._matrix = None
+        self._dirty = False
+        if self.embedding_error is not None or not self._chunks:
+            return
+        vectors = [_vector_cache.get(chunk.content_hash) for chunk in self._chunks]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Evicted from the shared cache since they were embedded
+            try:
+                embedded = self._embed([self._chunks[i].text for i in missing])
+            except Exception as e:
+                self._embedding_failed(e)
+                return
+            for i, vector in zip(missing, embedded):
+                _vector_cache.put(self._chunks[i].content_hash, vector)
+                vectors[i] = vector
+            self.stats["chunks_embedded"] += len(missing)
+        self._matrix = np.vstack(vectors)
+
+    def search(
+        self,
+        query: str,
+        file_patterns: str = "**/*",
+        max_results: int = 20,
+        refresh: bool = True,
+    ) -> List[SearchHit]:
+        """Rank chunks by a blend of vector similarity and keyword score."""
+        if refresh:
+            self.refresh()
+        with self._lock:
+            if not self._chunks:
+                return []
+            terms = expand_query_terms(query)
+            keyword_scores = np.array(
+                [keyword_score(terms, chunk.text) for chunk in self._chunks],
+                dtype=np.float32,
+            )
+            max_keyword = float(keyword_scores.max())
+            if max_keyword > 0:
+                keyword_norm = np.log1p(keyword_scores) / np.log1p(max_keyword)
+            else:
+                keyword_norm = keyword_scores
+            query_vector = None
+            if self._matrix is not None and self.embedding_error is None:
+                try:
+                    query_vector = self._embed([query])[0]
+                except Exception as e:
+                    self._embedding_failed(e)
+            if query_vector is not None:
+                vector_scores = self._matrix @ query_vector
+                combined = (
+                    VECTOR_WEIGHT * vector_scores + (1 - VECTOR_WEIGHT) * keyword_norm
+                )
+            else:
+                vector_scores = np.zeros(len(self._chunks), dtype=np.float32)
+                combined = keyword_norm
+            hits = []
+            for i in np.argsort(-combined, kind="stable"):
+                chunk = self._chunks[int(i)]
+                if file_patterns not in ("", "**/*") and not matches_glob(
+                    chunk.rel_path, file_patterns
+                ):
+                    continue
+                if query_vector is None and keyword_scores[i] <= 0:
+                    break
+                hits.append(
+                    SearchHit(
+                        chunk=chunk,
+                        score=float(combined[i]),
+                        vector_score=float(vector_scores[i]),
+                        keyword_score=float(keyword_scores[i]),
+                    )
+                )
+                if len(hits) >= max_results:
+                    break
+            return hits
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "files": len(self._file_chunks),
+                "chunks": len(self._chunks),
+                "vectors": 0 if self._matrix is None else len(self._matrix),
+                "embedding_error": self.embedding_error,
+            }
+
+
+_indexes: "OrderedDict[str, SemanticCodeIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_semantic_code_index(root: str) -> SemanticCodeIndex:
+    """Get (or create) the semantic index for a workspace directory."""
+    key = os.path.realpath(root)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = SemanticCodeIndex(key)
+            _indexes[key] = index
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
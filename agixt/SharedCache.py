@@ -11,6 +11,8 @@ The cache supports:
 - Graceful fallback to local memory
 - Prefix-based key namespacing
 - Cache invalidation (single key or pattern-based)
+- Owner-checked leases and pub/sub notifications across processes
+- Hashes whose fields are written independently by different processes
 
 Usage:
     from SharedCache import shared_cache
@@ -26,9 +28,20 @@ Usage:
 
     # Delete by pattern (only works with Redis)
     shared_cache.delete_pattern("agent:*")
+
+    # Renew a lease only while still holding it
+    shared_cache.set_if_equals("lease:x", "worker-1", "worker-1", ttl=30)
+
+    # Notify every process subscribed to a channel
+    shared_cache.publish("events", {"id": 1})
+
+    # One field of a hash, without rewriting the others
+    shared_cache.set_field("user:1:items", "item-9", {"name": "x"}, ttl=60)
+    shared_cache.get_fields("user:1:items")
 """
 
 import json
+import queue
 import time
 import logging
 import os
@@ -37,6 +50,71 @@ from threading import Lock
 
 logger = logging.getLogger(__name__)
 
+# Compare-and-set scripts so an owner check and its write are one Redis step
+_SET_IF_EQUALS_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    if tonumber(ARGV[3]) > 0 then
+        return redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3]) and 1
+    end
+    return redis.call('SET', KEYS[1], ARGV[2]) and 1
+end
+return 0
+"""
+_DELETE_IF_EQUALS_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class Subscription:
+    """
+    Messages published to one channel, read with get_message().
+
+    Backed by Redis pub/sub when available, otherwise by an in-process queue
+    that only sees messages published from the same process.
+    """
+
+    def __init__(self, channel: str, pubsub=None, on_close=None):
+        self.channel = channel
+        self._pubsub = pubsub
+        self._queue = queue.Queue()
+        self._on_close = on_close
+
+    def _deliver(self, message: Any):
+        self._queue.put(message)
+
+    def get_message(self, timeout: float = 1.0) -> Optional[Any]:
+        """Wait up to timeout seconds for the next message, None if there is none."""
+        if self._pubsub is not None:
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = max(0.0, deadline - time.monotonic())
+                message = self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=remaining
+                )
+                if message and message.get("type") == "message":
+                    try:
+                        return json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        return None
+                if remaining <= 0:
+                    return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+        if self._on_close:
+            self._on_close(self)
+
 
 class SharedCache:
     """
@@ -66,6 +144,7 @@ class SharedCache:
         self._redis = None
         self._local_cache = {}  # Fallback
         self._local_cache_lock = Lock()
+        self._local_subscribers = {}  # channel -> [Subscription]
         self._prefix = "agixt:"
 
         self._init_redis()
@@ -235,6 +314,202 @@ class SharedCache:
             }
         return True
 
+    def set_if_equals(self, key: str, expected: Any, value: Any, ttl: int = 0) -> bool:
+        """
+        Set a value only if the key currently holds expected (atomic).
+        Used to renew a lease only while still owning it.
+        """
+        full_key = self._make_key(key)
+
+        try:
+            serialized_expected = json.dumps(expected)
+            serialized = json.dumps(value)
+        except (TypeError, ValueError):
+            return False
+
+        if self._redis is not None:
+            try:
+                result = self._redis.eval(
+                    _SET_IF_EQUALS_SCRIPT,
+                    1,
+                    full_key,
+                    serialized_expected,
+                    serialized,
+                    int(ttl),
+                )
+                return bool(result)
+            except Exception as e:
+                logger.debug(f"SharedCache Redis set_if_equals error: {e}")
+
+        with self._local_cache_lock:
+            entry = self._local_cache.get(full_key)
+            if entry is None or (
+                entry["expires_at"] and time.time() > entry["expires_at"]
+            ):
+                return False
+            if entry["value"] != expected:
+                return False
+            self._local_cache[full_key] = {
+                "value": value,
+                "expires_at": time.time() + ttl if ttl > 0 else None,
+            }
+        return True
+
+    def delete_if_equals(self, key: str, expected: Any) -> bool:
+        """Delete a key only if it currently holds expected (atomic)."""
+        full_key = self._make_key(key)
+
+        try:
+            serialized_expected = json.dumps(expected)
+        except (TypeError, ValueError):
+            return False
+
+        if self._redis is not None:
+            try:
+                return bool(
+                    self._redis.eval(
+                        _DELETE_IF_EQUALS_SCRIPT, 1, full_key, serialized_expected
+                    )
+                )
+            except Exception as e:
+                logger.debug(f"SharedCache Redis delete_if_equals error: {e}")
+
+        with self._local_cache_lock:
+            entry = self._local_cache.get(full_key)
+            if entry is None or entry["value"] != expected:
+                return False
+            del self._local_cache[full_key]
+        return True
+
+    def set_field(self, key: str, field: str, value: Any, ttl: int = 0) -> bool:
+        """
+        Set one field of the hash at key, leaving its other fields alone.
+
+        ttl (seconds) applies to the whole hash and is renewed by every write.
+        """
+        full_key = self._make_key(key)
+
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError):
+            return False
+
+        if self._redis is not None:
+            try:
+                pipeline = self._redis.pipeline()
+                pipeline.hset(full_key, field, serialized)
+                if ttl > 0:
+                    pipeline.expire(full_key, ttl)
+                pipeline.execute()
+                return True
+            except Exception as e:
+                logger.debug(f"SharedCache Redis set_field error: {e}")
+
+        with self._local_cache_lock:
+            entry = self._local_cache.get(full_key)
+            if entry is None or (
+                entry["expires_at"] and time.time() > entry["expires_at"]
+            ):
+                entry = {"value": {}, "expires_at": None}
+                self._local_cache[full_key] = entry
+            entry["value"][field] = json.loads(serialized)
+            if ttl > 0:
+                entry["expires_at"] = time.time() + ttl
+        return True
+
+    def delete_field(self, key: str, field: str) -> bool:
+        """Delete one field of the hash at key."""
+        full_key = self._make_key(key)
+
+        if self._redis is not None:
+            try:
+                return self._redis.hdel(full_key, field) > 0
+            except Exception as e:
+                logger.debug(f"SharedCache Redis delete_field error: {e}")
+
+        with self._local_cache_lock:
+            entry = self._local_cache.get(full_key)
+            if entry is None or field not in entry["value"]:
+                return False
+            del entry["value"][field]
+            if not entry["value"]:
+                del self._local_cache[full_key]
+        return True
+
+    def get_fields(self, key: str) -> dict:
+        """All fields of the hash at key, {} if there is none."""
+        full_key = self._make_key(key)
+
+        if self._redis is not None:
+            try:
+                fields = {}
+                for field, value in self._redis.hgetall(full_key).items():
+                    try:
+                        fields[field] = json.loads(value)
+                    except (TypeError, ValueError):
+                        continue
+                return fields
+            except Exception as e:
+                logger.debug(f"SharedCache Redis get_fields error: {e}")
+
+        with self._local_cache_lock:
+            entry = self._local_cache.get(full_key)
+            if entry is None:
+                return {}
+            if entry["expires_at"] and time.time() > entry["expires_at"]:
+                del self._local_cache[full_key]
+                return {}
+            return dict(entry["value"])
+
+    def publish(self, channel: str, message: Any) -> int:
+        """
+        Publish a JSON-serializable message to every subscriber of a channel.
+
+        Returns:
+            The number of subscribers that received it
+        """
+        full_channel = self._make_key(channel)
+
+        try:
+            serialized = json.dumps(message)
+        except (TypeError, ValueError):
+            return 0
+
+        if self._redis is not None:
+            try:
+                return int(self._redis.publish(full_channel, serialized))
+            except Exception as e:
+                logger.debug(f"SharedCache Redis publish error: {e}")
+
+        with self._local_cache_lock:
+            subscribers = list(self._local_subscribers.get(full_channel, []))
+        for subscription in subscribers:
+            subscription._deliver(json.loads(serialized))
+        return len(subscribers)
+
+    def subscribe(self, channel: str) -> Subscription:
+        """Subscribe to a channel; read messages with get_message() and close() when done."""
+        full_channel = self._make_key(channel)
+
+        if self._redis is not None:
+            try:
+                pubsub = self._redis.pubsub()
+                pubsub.subscribe(full_channel)
+                return Subscription(channel, pubsub=pubsub)
+            except Exception as e:
+                logger.debug(f"SharedCache Redis subscribe error: {e}")
+
+        def unsubscribe(subscription):
+            with self._local_cache_lock:
+                subscribers = self._local_subscribers.get(full_channel, [])
+                if subscription in subscribers:
+                    subscribers.remove(subscription)
+
+        subscription = Subscription(channel, on_close=unsubscribe)
+        with self._local_cache_lock:
+            self._local_subscribers.setdefault(full_channel, []).append(subscription)
+        return subscription
+
     def delete(self, key: str) -> bool:
         """
         Delete a key from the cache.
@@ -44,6 +44,16 @@ except Exception as e:
 
 from DB import get_session, CompanyExtensionSetting, Company
 from Globals import getenv
+from BotRuntime import BotRuntime, CompanyInbox
+from BotPipeline import (
+    ConversationPipeline,
+    InboundMessage,
+    StreamingReply,
+    iter_stream_content,
+    platform_channels,
+    platform_users,
+    split_message,
+)
 from MagicalAuth import impersonate_user
 from InternalClient import InternalClient
 from Models import ChatCompletions
@@ -129,6 +139,11 @@ class CompanySlackBot:
         self._started_at: Optional[datetime] = None
         self._workspace_name = ""
         self._bot_user_id = None
+        # Messages are handled from a bounded per-company queue
+        self.inbox = CompanyInbox(company_id)
+        # Bursts in a conversation become one ordered agent turn
+        self.pipeline = ConversationPipeline(self._handle_inbound, inbox=self.inbox)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
 
     def _refresh_slack_user_cache(self):
         """Refresh the Slack user ID -> email mapping cache."""
@@ -146,9 +161,76 @@ class CompanySlackBot:
 
     def _get_user_email_from_slack_id(self, slack_id: str) -> Optional[str]:
         """Get user email from Slack ID, refreshing cache if needed."""
-        if slack_id not in self.slack_user_cache:
+        if slack_id in self.slack_user_cache:
+            return self.slack_user_cache[slack_id]
+
+        def refresh():
             self._refresh_slack_user_cache()
-        return self.slack_user_cache.get(slack_id)
+            return self.slack_user_cache.get(slack_id)
+
+        # Unlinked users only refresh the mapping once per miss TTL
+        return platform_users.get_or_load(
+            ("slack", self.company_id, "email", slack_id), refresh
+        )
+
+    def _get_slack_user_name(self, slack_id: str) -> str:
+        """Display name of a Slack user, shared across bots for the lookup TTL."""
+
+        def load():
+            try:
+                user = self.web_client.users_info(user=slack_id).get("user", {})
+                return user.get("real_name") or user.get("name") or slack_id
+            except Exception:
+                return slack_id
+
+        return platform_users.get_or_load(
+            ("slack", self.company_id, "name", slack_id), load
+        )
+
+    def _get_slack_channel_name(self, channel_id: str) -> str:
+        """Name of a Slack channel, shared across bots for the lookup TTL."""
+
+        def load():
+            try:
+                channel_info = self.web_client.conversations_info(channel=channel_id)
+                return channel_info.get("channel", {}).get("name", channel_id)
+            except Exception:
+                return channel_id
+
+        return platform_channels.get_or_load(
+            ("slack", self.company_id, channel_id), load
+        )
+
+    def _to_inbound(self, event: dict) -> Optional[InboundMessage]:
+        """Normalize a Slack message event; None for events the bot ignores."""
+        if event.get("bot_id") or event.get("subtype") == "bot_message":
+            return None
+        text = event.get("text", "")
+        bot_mention = f"<@{self._bot_user_id}>"
+        if event.get("channel_type") != "im" and bot_mention not in text:
+            return None
+        user_id = event.get("user", "")
+        channel_id = event.get("channel", "")
+        thread_ts = event.get("thread_ts") or ""
+        return InboundMessage(
+            platform="slack",
+            company_id=self.company_id,
+            conversation_key=f"{channel_id}:{thread_ts}:{user_id}",
+            user_id=user_id,
+            text=text,
+            channel_id=channel_id,
+            message_id=event.get("ts", ""),
+            reply_to=thread_ts or event.get("ts", ""),
+            files=event.get("files", []),
+            is_command=text.replace(bot_mention, "").strip().startswith("!"),
+            raw=event,
+        )
+
+    async def _handle_inbound(self, message: InboundMessage):
+        """Handle one turn of the pipeline (one message or a merged burst)."""
+        await self._handle_message(
+            {**message.raw, "text": message.text, "files": message.files}
+        )
 
     def _get_conversation_name(self, channel_id: str, channel_name: str = None) -> str:
         """Generate a conversation name based on the Slack context."""
@@ -357,11 +439,7 @@ class CompanySlackBot:
 
         try:
             # Get channel info for context
-            try:
-                channel_info = self.web_client.conversations_info(channel=channel_id)
-                channel_name = channel_info.get("channel", {}).get("name", channel_id)
-            except Exception:
-                channel_name = channel_id
+            channel_name = self._get_slack_channel_name(channel_id)
 
             conversation_name = self._get_conversation_name(channel_id, channel_name)
 
@@ -434,55 +512,28 @@ class CompanySlackBot:
                 stream=True,
             )
 
-            # Collect response
-            full_response = ""
-            stream_done = False
-            async for chunk in agixt_instance.chat_completions_stream(
-                prompt=chat_prompt
-            ):
-                if stream_done:
-                    break
-                for line in chunk.split("\n"):
-                    line = line.strip()
-                    if not line.startswith("data: "):
-                        continue
-                    data = line[6:].strip()
-                    if data == "[DONE]":
-                        stream_done = True
-                        break
-                    try:
-                        import json
-
-                        chunk_data = json.loads(data)
-                        if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
-                            delta = chunk_data["choices"][0].get("delta", {})
-                            content_chunk = delta.get("content", "")
-                            if content_chunk:
-                                full_response += content_chunk
-                    except json.JSONDecodeError:
-                        pass
-
-            reply = (
-                full_response.strip()
-                if full_response
-                else "I couldn't generate a response."
-            )
-
-            # Split long messages
-            if len(reply) > 4000:
-                chunks = self._split_message(reply, 4000)
-                for chunk in chunks:
-                    self.web_client.chat_postMessage(
-                        channel=channel_id,
-                        thread_ts=thread_ts,
-                        text=chunk,
-                    )
-            else:
-                self.web_client.chat_postMessage(
+            # Post the reply as it streams in, continuing in new messages
+            # past Slack's length limit
+            async def post(text):
+                response = await asyncio.to_thread(
+                    self.web_client.chat_postMessage,
                     channel=channel_id,
                     thread_ts=thread_ts,
-                    text=reply,
+                    text=text,
                 )
+                return response.get("ts")
+
+            async def update(ts, text):
+                await asyncio.to_thread(
+                    self.web_client.chat_update, channel=channel_id, ts=ts, text=text
+                )
+
+            reply = StreamingReply(send=post, edit=update, max_length=4000)
+            async for delta in iter_stream_content(
+                agixt_instance.chat_completions_stream(prompt=chat_prompt)
+            ):
+                await reply.push(delta)
+            await reply.finish()
 
         except Exception as e:
             logger.error(
@@ -624,25 +675,14 @@ class CompanySlackBot:
             if not messages:
                 return "**SLACK CHANNEL CONTEXT**: No conversation history found."
 
-            # Get user info for display names
-            user_cache = {}
-
-            def get_user_name(user_id):
-                if user_id not in user_cache:
-                    try:
-                        user_info = self.web_client.users_info(user=user_id)
-                        user = user_info.get("user", {})
-                        user_cache[user_id] = (
-                            user.get("real_name") or user.get("name") or user_id
-                        )
-                    except Exception:
-                        user_cache[user_id] = user_id
-                return user_cache[user_id]
-
             formatted_messages = []
             for msg in reversed(messages):
                 user_id = msg.get("user", "Unknown")
-                user_name = get_user_name(user_id) if user_id != "Unknown" else "Bot"
+                user_name = (
+                    self._get_slack_user_name(user_id)
+                    if user_id != "Unknown"
+                    else "Bot"
+                )
                 text = msg.get("text", "[No text]")
                 ts = msg.get("ts", "")
 
@@ -670,26 +710,7 @@ Total messages: {len(messages)}
 
     def _split_message(self, text: str, max_length: int = 4000) -> list:
         """Split a message into chunks."""
-        if len(text) <= max_length:
-            return [text]
-
-        chunks = []
-        remaining = text
-
-        while len(remaining) > max_length:
-            split_point = remaining.rfind("\n", 0, max_length)
-            if split_point == -1 or split_point < max_length * 0.3:
-                split_point = remaining.rfind(" ", 0, max_length)
-            if split_point == -1:
-                split_point = max_length
-
-            chunks.append(remaining[:split_point].rstrip())
-            remaining = remaining[split_point:].lstrip()
-
-        if remaining:
-            chunks.append(remaining)
-
-        return chunks
+        return split_message(text, max_length)
 
     def _handle_socket_message(
         self, client: "SocketModeClient", req: "SocketModeRequest"
@@ -704,12 +725,16 @@ Total messages: {len(messages)}
             event_type = event.get("type")
 
             if event_type == "message" or event_type == "app_mention":
-                # Run message handler in asyncio
-                asyncio.create_task(self._handle_message(event))
+                # Socket mode listeners run on the SDK's thread; hand the
+                # message to the bot's event loop
+                message = self._to_inbound(event)
+                if message is not None and self._loop is not None:
+                    self._loop.call_soon_threadsafe(self.pipeline.submit, message)
 
     async def start(self):
         """Start the Slack bot."""
         try:
+            self._loop = asyncio.get_running_loop()
             # Get bot user ID
             auth_response = self.web_client.auth_test()
             self._bot_user_id = auth_response.get("user_id")
@@ -751,6 +776,8 @@ Total messages: {len(messages)}
     async def stop(self):
         """Stop the Slack bot gracefully."""
         self._is_ready = False
+        await self.pipeline.close()
+        await self.inbox.close()
         if self.socket_client:
             try:
                 self.socket_client.disconnect()
@@ -782,6 +809,8 @@ class SlackBotManager:
         self._tasks: Dict[str, asyncio.Task] = {}
         self._running = False
         self._monitor_task: Optional[asyncio.Task] = None
+        # Set when bots are owned through the sharded BotRuntime
+        self.runtime: Optional[BotRuntime] = None
 
     def get_server_bot_tokens(self) -> tuple:
         """Get the server-level Slack bot and app tokens."""
@@ -831,12 +860,14 @@ class SlackBotManager:
 
         return bot_token, app_token
 
-    def get_company_bot_config(self) -> Dict[str, Dict[str, str]]:
-        """Get Slack bot configuration for all companies."""
+    def get_company_bot_config(
+        self, company_id: str = None
+    ) -> Dict[str, Dict[str, str]]:
+        """Get Slack bot configuration for all companies, or for one."""
         configs = {}
 
         with get_session() as db:
-            settings = (
+            query = (
                 db.query(CompanyExtensionSetting)
                 .filter(CompanyExtensionSetting.extension_name == "slack")
                 .filter(
@@ -851,8 +882,10 @@ class SlackBotManager:
                         ]
                     )
                 )
-                .all()
             )
+            if company_id:
+                query = query.filter(CompanyExtensionSetting.company_id == company_id)
+            settings = query.all()
 
             for setting in settings:
                 company_id = str(setting.company_id)
@@ -893,6 +926,37 @@ class SlackBotManager:
 
         return configs
 
+    def is_bot_runnable(self, config: Dict[str, str]) -> bool:
+        """Whether a company config is enabled and has both tokens."""
+        return bool(
+            (config.get("enabled") or "").lower() == "true"
+            and config.get("bot_token")
+            and config.get("app_token")
+        )
+
+    def get_server_bot_config(self) -> Optional[Dict[str, str]]:
+        """Config of the server-level bot shared by all companies, if any."""
+        bot_token, app_token = self.get_server_bot_tokens()
+        if not (bot_token and app_token):
+            return None
+        return {
+            "name": "AGiXT Server Bot",
+            "bot_token": bot_token,
+            "app_token": app_token,
+        }
+
+    async def start_bot_from_config(self, bot_id: str, config: Dict[str, str]) -> bool:
+        """Start a bot from a get_company_bot_config / get_server_bot_config entry."""
+        return await self.start_bot_for_company(
+            company_id=bot_id,
+            company_name=config["name"],
+            bot_token=config["bot_token"],
+            app_token=config["app_token"],
+            agent_id=config.get("agent_id"),
+            permission_mode=config.get("permission_mode") or "recognized_users",
+            owner_id=config.get("owner_id"),
+        )
+
     async def start_bot_for_company(
         self,
         company_id: str,
@@ -985,10 +1049,7 @@ class SlackBotManager:
         company_configs = self.get_company_bot_config()
 
         company_bots_configured = any(
-            config.get("enabled", "").lower() == "true"
-            and config.get("bot_token")
-            and config.get("app_token")
-            for config in company_configs.values()
+            self.is_bot_runnable(config) for config in company_configs.values()
         )
 
         if company_bots_configured:
@@ -1010,23 +1071,8 @@ class SlackBotManager:
                 await self.stop_bot_for_company(company_id)
 
             for company_id, config in company_configs.items():
-                if (
-                    config.get("enabled", "").lower() == "true"
-                    and config.get("bot_token")
-                    and config.get("app_token")
-                    and company_id not in self.bots
-                ):
-                    await self.start_bot_for_company(
-                        company_id=company_id,
-                        company_name=config["name"],
-                        bot_token=config["bot_token"],
-                        app_token=config["app_token"],
-                        agent_id=config.get("agent_id"),
-                        permission_mode=config.get(
-                            "permission_mode", "recognized_users"
-                        ),
-                        owner_id=config.get("owner_id"),
-                    )
+                if self.is_bot_runnable(config) and company_id not in self.bots:
+                    await self.start_bot_from_config(company_id, config)
 
         elif server_bot_token and server_app_token:
             for company_id in list(self.bots.keys()):
@@ -1128,7 +1174,10 @@ async def start_slack_bot_manager():
 
     if _manager is None:
         _manager = SlackBotManager()
-    await _manager.start()
+    # Bots hashed to this worker, started and restarted on config events
+    if _manager.runtime is None:
+        _manager.runtime = BotRuntime("slack", _manager)
+    await _manager.runtime.start()
     return _manager
 
 
@@ -1136,5 +1185,7 @@ async def stop_slack_bot_manager():
     """Stop the global Slack bot manager."""
     global _manager
     if _manager:
+        if _manager.runtime is not None:
+            await _manager.runtime.stop()
         await _manager.stop()
         _manager = None
@@ -0,0 +1,565 @@
+"""
+SpeechStream - Incremental speech-to-text for voice sessions
+
+Voice sessions used to collect a whole utterance, wait for the client to
+say it was done and post the complete recording for transcription, so the
+time between the end of speech and the agent's first audio grew with the
+length of the utterance before the thinker model even started.
+
+This module transcribes while the user is still speaking:
+
+- `EnergyEndpointer`: splits a stream of 16-bit mono PCM into utterances
+  from frame energy against an adaptive noise floor, with a short preroll
+  so the first syllable is not cut off
+- `STTProvider` / `STTStream`: the provider contract. A streaming provider
+  takes PCM frames and reports partial hypotheses as they change; a provider
+  with only a batch endpoint gets `BatchSTTStream`, which re-transcribes the
+  utterance so far at a bounded rate and at every pause, and reuses the last
+  partial as the final transcript when it already covers all voiced audio
+- `StreamingTranscriber`: drives the endpointer and one provider stream per
+  utterance, reports partials (marking stable ones) and finals in order
+- `SpeculativeTurn`: work started from a stable partial, kept when the final
+  transcript matches it and cancelled otherwise
+
+Usage:
+    transcriber = StreamingTranscriber(
+        VoiceServerSTT(voice_server, api_key),
+        on_partial=show_partial,      # async (text, stable)
+        on_final=handle_transcript,   # async (text, speech_ended_at)
+    )
+    await transcriber.feed(pcm_frame)
+"""
+
+import asyncio
+import functools
+import io
+import logging
+import os
+import re
+import time
+import wave
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Input audio: 16-bit mono PCM at this rate, analysed in frames of this size
+STT_SAMPLE_RATE = int(os.getenv("STT_SAMPLE_RATE", "16000"))
+STT_FRAME_MS = int(os.getenv("STT_FRAME_MS", "20"))
+# Input sample rates a client may ask for
+MIN_INPUT_SAMPLE_RATE = 8000
+MAX_INPUT_SAMPLE_RATE = 48000
+# Voiced audio needed to start an utterance, and silence that ends it
+STT_SPEECH_START_MS = int(os.getenv("STT_SPEECH_START_MS", "60"))
+STT_SPEECH_END_MS = int(os.getenv("STT_SPEECH_END_MS", "600"))
+# A frame is voiced above both the absolute RMS floor and ratio x noise floor
+STT_MIN_ENERGY = float(os.getenv("STT_MIN_ENERGY", "500"))
+STT_ENERGY_RATIO = float(os.getenv("STT_ENERGY_RATIO", "3.0"))
+# Audio kept from before the start of speech
+STT_PREROLL_MS = int(os.getenv("STT_PREROLL_MS", "200"))
+# Longest utterance before it is ended regardless of silence
+STT_MAX_UTTERANCE_SECONDS = float(os.getenv("STT_MAX_UTTERANCE_SECONDS", "30"))
+# Batch providers: seconds of new speech between partials, and the pause
+# after which the utterance so far is transcribed as a final candidate
+STT_PARTIAL_INTERVAL = float(os.getenv("STT_PARTIAL_INTERVAL", "0.8"))
+STT_PAUSE_MS = int(os.getenv("STT_PAUSE_MS", "200"))
+# Identical consecutive partials that make a hypothesis stable
+STT_STABLE_PARTIALS = int(os.getenv("STT_STABLE_PARTIALS", "2"))
+
+PartialCallback = Callable[..., Awaitable[None]]
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = STT_SAMPLE_RATE) -> bytes:
+    """Wrap 16-bit mono PCM in a WAV container for batch endpoints."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def normalize_transcript(text: str) -> str:
+    """Compare transcripts without case, punctuation or spacing differences."""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def frame_energy(frame: bytes) -> float:
+    """Root mean square amplitude of a 16-bit PCM frame."""
+    samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+    if not samples.size:
+        return 0.0
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+@dataclass
+class EndpointEvent:
+    """kind is "start" (audio holds the preroll), "audio" or "end"."""
+
+    kind: str
+    audio: bytes = b""
+    voiced: bool = False
+
+
+def parse_sample_rate(value) -> int:
+    """A client-sent input sample rate; ValueError unless it is supported."""
+    if value in (None, ""):
+        return STT_SAMPLE_RATE
+    try:
+        rate = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid input_sample_rate: {value!r}")
+    if not MIN_INPUT_SAMPLE_RATE <= rate <= MAX_INPUT_SAMPLE_RATE:
+        raise ValueError(
+            f"input_sample_rate must be between {MIN_INPUT_SAMPLE_RATE} and "
+            f"{MAX_INPUT_SAMPLE_RATE} Hz"
+        )
+    return rate
+
+
+class EnergyEndpointer:
+    """Energy based voice activity detection over fixed-size PCM frames."""
+
+    def __init__(
+        self,
+        sample_rate: int = STT_SAMPLE_RATE,
+        frame_ms: int = STT_FRAME_MS,
+        start_ms: int = STT_SPEECH_START_MS,
+        end_ms: int = STT_SPEECH_END_MS,
+        min_energy: float = STT_MIN_ENERGY,
+        energy_ratio: float = STT_ENERGY_RATIO,
+        preroll_ms: int = STT_PREROLL_MS,
+        max_utterance_seconds: float = STT_MAX_UTTERANCE_SECONDS,
+    ):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        # feed() consumes whole frames; an empty frame would never drain
+        if self.frame_bytes <= 0:
+            raise ValueError(
+                f"A {frame_ms}ms frame at {sample_rate} Hz holds no samples"
+            )
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.end_frames = max(1, end_ms // frame_ms)
+        self.max_frames = max(1, int(max_utterance_seconds * 1000 / frame_ms))
+        self.min_energy = min_energy
+        self.energy_ratio = energy_ratio
+        self.noise_floor = min_energy / energy_ratio
+        self.in_speech = False
+        self._pending = bytearray()
+        self._preroll = deque(maxlen=max(1, preroll_ms // frame_ms) + self.start_frames)
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._utterance_frames = 0
+
+    def feed(self, pcm: bytes) -> List[EndpointEvent]:
+        """Add PCM of any length; returns the events of every complete frame."""
+        self._pending.extend(pcm)
+        events = []
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[: self.frame_bytes])
+            del self._pending[: self.frame_bytes]
+            events.extend(self._frame(frame))
+        return events
+
+    def flush(self) -> List[EndpointEvent]:
+        """End the current utterance now (the client said it stopped)."""
+        self._pending.clear()
+        return [self._end()] if self.in_speech else []
+
+    def _frame(self, frame: bytes) -> List[EndpointEvent]:
+        energy = frame_energy(frame)
+        voiced = energy >= max(self.min_energy, self.noise_floor * self.energy_ratio)
+        if not self.in_speech:
+            self._preroll.append(frame)
+            if not voiced:
+                self._voiced_run = 0
+                self.noise_floor = 0.95 * self.noise_floor + 0.05 * energy
+                return []
+            self._voiced_run += 1
+            if self._voiced_run < self.start_frames:
+                return []
+            self.in_speech = True
+            self._silent_run = 0
+            self._utterance_frames = len(self._preroll)
+            audio = b"".join(self._preroll)
+            self._preroll.clear()
+            return [EndpointEvent("start", audio, True)]
+
+        self._utterance_frames += 1
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        events = [EndpointEvent("audio", frame, voiced)]
+        if (
+            self._silent_run >= self.end_frames
+            or self._utterance_frames >= self.max_frames
+        ):
+            events.append(self._end())
+        return events
+
+    def _end(self) -> EndpointEvent:
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._utterance_frames = 0
+        return EndpointEvent("end")
+
+
+class STTStream:
+    """
+    One utterance being transcribed. send() takes PCM frames as they arrive
+    and must not wait on the provider; partial hypotheses are reported to
+    on_partial(text, stable) whenever they change. finish() returns the
+    final transcript.
+    """
+
+    def __init__(self, sample_rate: int, on_partial: Optional[PartialCallback] = None):
+        self.sample_rate = sample_rate
+        self.on_partial = on_partial
+
+    async def send(self, pcm: bytes, voiced: bool = True):
+        raise NotImplementedError
+
+    async def finish(self) -> str:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def _report(self, text: str, stable: bool = False):
+        if not self.on_partial or not text:
+            return
+        try:
+            await self.on_partial(text, stable)
+        except Exception as e:
+            logger.warning(f"Partial transcript handler failed: {e}")
+
+
+class STTProvider:
+    """
+    A speech-to-text backend. transcribe() is the batch contract (a complete
+    audio file in, text out). Providers that can transcribe incrementally set
+    streaming = True and return their own STTStream from open_stream();
+    the default adapts the batch contract with BatchSTTStream.
+    """
+
+    streaming = False
+
+    async def transcribe(
+        self, audio: bytes, filename: str = "audio.wav", content_type: str = "audio/wav"
+    ) -> str:
+        raise NotImplementedError
+
+    def open_stream(
+        self, sample_rate: int, on_partial: Optional[PartialCallback] = None
+    ) -> STTStream:
+        return BatchSTTStream(self, sample_rate, on_partial=on_partial)
+
+
+class BatchSTTStream(STTStream):
+    """
+    Streams over a batch endpoint: the utterance so far is re-transcribed
+    after every STT_PARTIAL_INTERVAL of new speech (one request in flight at
+    a time) and as soon as the speaker pauses. A pause partial covers all
+    voiced audio, so when the endpointer then ends the utterance it is
+    returned as the final transcript without another request.
+    """
+
+    def __init__(
+        self,
+        provider: STTProvider,
+        sample_rate: int,
+        on_partial: Optional[PartialCallback] = None,
+        partial_interval: float = STT_PARTIAL_INTERVAL,
+        pause_ms: int = STT_PAUSE_MS,
+        tail_ms: int = STT_PREROLL_MS,
+    ):
+        super().__init__(sample_rate, on_partial)
+        self.provider = provider
+        self.audio = bytearray()
+        self.transcriptions = 0
+        self.reused_partial = False
+        self._interval_bytes = int(partial_interval * sample_rate) * 2
+        self._pause_bytes = sample_rate * pause_ms // 1000 * 2
+        self._tail_bytes = sample_rate * tail_ms // 1000 * 2
+        self._voiced_end = 0
+        # Bytes covered by the last finished partial, and its text
+        self._covered = 0
+        self._text = ""
+        self._task: Optional[asyncio.Task] = None
+        self._task_end = 0
+
+    async def send(self, pcm: bytes, voiced: bool = True):
+        self.audio.extend(pcm)
+        if voiced:
+            self._voiced_end = len(self.audio)
+        if self._covered >= self._voiced_end:
+            return
+        busy = self._task is not None and not self._task.done()
+        if len(self.audio) - self._voiced_end >= self._pause_bytes:
+            # Speaker paused: this may be the end, transcribe everything voiced
+            if busy and self._task_end >= self._voiced_end:
+                return
+            if busy:
+                self._task.cancel()
+            self._start(len(self.audio), stable=True)
+        elif (
+            not busy
+            and self.on_partial
+            and self._interval_bytes
+            and self._voiced_end - self._covered >= self._interval_bytes
+        ):
+            self._start(len(self.audio), stable=False)
+
+    def _start(self, end: int, stable: bool):
+        self._task_end = end
+        self._task = asyncio.ensure_future(self._partial(end, stable))
+
+    async def _partial(self, end: int, stable: bool):
+        text = await self._transcribe(end)
+        if text is None:
+            return
+        self._covered, self._text = end, text
+        await self._report(text, stable)
+
+    async def _transcribe(self, end: int) -> Optional[str]:
+        self.transcriptions += 1
+        try:
+            text = await self.provider.transcribe(
+                pcm_to_wav(bytes(self.audio[:end]), self.sample_rate)
+            )
+        except Exception as e:
+            logger.warning(f"Transcription request failed: {e}")
+            return None
+        return (text or "").strip()
+
+    async def finish(self) -> str:
+        if self._task and not self._task.done():
+            if self._task_end >= self._voiced_end:
+                await asyncio.gather(self._task, return_exceptions=True)
+            else:
+                self._task.cancel()
+        if self._text and self._covered >= self._voiced_end:
+            self.reused_partial = True
+            return self._text
+        end = min(len(self.audio), self._voiced_end + self._tail_bytes)
+        return await self._transcribe(end) or ""
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+
+class VoiceServerSTT(STTProvider):
+    """Batch transcription through the voice server's /v1/audio/transcriptions."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "none",
+        model: str = "base",
+        client: Optional[Callable[[], httpx.AsyncClient]] = None,
+        timeout: float = 30.0,
+    ):
+        self.url = base_url.rstrip("/") + "/v1/audio/transcriptions"
+        self.api_key = api_key or "none"
+        self.model = model
+        self.client = client
+        self.timeout = timeout
+
+    async def transcribe(
+        self, audio: bytes, filename: str = "audio.wav", content_type: str = "audio/wav"
+    ) -> str:
+        request = dict(
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            files={"file": (filename, audio, content_type)},
+            data={"model": self.model},
+            timeout=self.timeout,
+        )
+        if self.client:
+            response = await self.client().post(self.url, **request)
+        else:
+            async with httpx.AsyncClient() as client:
+                response = await client.post(self.url, **request)
+        response.raise_for_status()
+        return response.json().get("text", "").strip()
+
+
+class StreamingTranscriber:
+    """
+    Feeds PCM through the endpointer and a provider stream per utterance.
+
+    on_partial(text, stable) is awaited for each new hypothesis of the
+    current utterance; a hypothesis is stable when the provider says so or
+    it repeats STT_STABLE_PARTIALS times. on_speech_end() is awaited as soon
+    as the endpointer decides speech has ended, before the provider returns
+    the final transcript. on_final(text, speech_ended_at) is awaited once per
+    utterance, in order, with the monotonic time of that decision.
+    """
+
+    def __init__(
+        self,
+        provider: STTProvider,
+        on_partial: Optional[PartialCallback] = None,
+        on_final: Optional[Callable[[str, float], Awaitable[None]]] = None,
+        on_speech_start: Optional[Callable[[], Awaitable[None]]] = None,
+        on_speech_end: Optional[Callable[[], Awaitable[None]]] = None,
+        sample_rate: int = STT_SAMPLE_RATE,
+        endpointer: Optional[EnergyEndpointer] = None,
+        stable_partials: int = STT_STABLE_PARTIALS,
+    ):
+        self.provider = provider
+        self.on_partial = on_partial
+        self.on_final = on_final
+        self.on_speech_start = on_speech_start
+        self.on_speech_end = on_speech_end
+        self.sample_rate = sample_rate
+        self.endpointer = endpointer or EnergyEndpointer(sample_rate=sample_rate)
+        self.stable_partials = stable_partials
+        self._stream: Optional[STTStream] = None
+        self._utterance = 0
+        self._last_key = ""
+        self._repeats = 0
+        self._finals: Optional[asyncio.Task] = None
+        self.stats = {
+            "utterances": 0,
+            "partials": 0,
+            "stable_partials": 0,
+            "empty": 0,
+            "failed": 0,
+        }
+
+    @property
+    def in_speech(self) -> bool:
+        return self._stream is not None
+
+    async def feed(self, pcm: bytes):
+        for event in self.endpointer.feed(pcm):
+            await self._handle(event)
+
+    async def flush(self):
+        """End the current utterance without waiting for trailing silence."""
+        for event in self.endpointer.flush():
+            await self._handle(event)
+
+    async def join(self):
+        """Wait until every ended utterance has been delivered to on_final."""
+        while self._finals and not self._finals.done():
+            await asyncio.gather(self._finals, return_exceptions=True)
+
+    async def close(self):
+        if self._stream:
+            await self._stream.close()
+            self._stream = None
+        if self._finals and not self._finals.done():
+            self._finals.cancel()
+
+    async def _handle(self, event: EndpointEvent):
+        if event.kind == "start":
+            self._utterance += 1
+            self._last_key, self._repeats = "", 0
+            self.stats["utterances"] += 1
+            self._stream = self.provider.open_stream(
+                self.sample_rate,
+                on_partial=functools.partial(self._partial, self._utterance),
+            )
+            if self.on_speech_start:
+                await self.on_speech_start()
+            await self._stream.send(event.audio, True)
+        elif event.kind == "audio" and self._stream:
+            await self._stream.send(event.audio, event.voiced)
+        elif event.kind == "end" and self._stream:
+            stream, self._stream = self._stream, None
+            self._finals = asyncio.ensure_future(
+                self._finish(stream, time.monotonic(), self._finals)
+            )
+            if self.on_speech_end:
+                await self.on_speech_end()
+
+    async def _partial(self, utterance: int, text: str, stable: bool = False):
+        if utterance != self._utterance or not self._stream:
+            return
+        key = normalize_transcript(text)
+        if not key:
+            return
+        self._repeats = self._repeats + 1 if key == self._last_key else 1
+        self._last_key = key
+        stable = stable or self._repeats >= self.stable_partials
+        self.stats["partials"] += 1
+        if stable:
+            self.stats["stable_partials"] += 1
+        if self.on_partial:
+            await self.on_partial(text, stable)
+
+    async def _finish(
+        self,
+        stream: STTStream,
+        speech_ended_at: float,
+        previous: Optional[asyncio.Task],
+    ):
+        try:
+            text = (await stream.finish()).strip()
+        except Exception as e:
+            logger.error(f"Final transcription failed: {e}")
+            self.stats["failed"] += 1
+            text = ""
+        finally:
+            await stream.close()
+        if previous:
+            await asyncio.gather(previous, return_exceptions=True)
+        if not text:
+            self.stats["empty"] += 1
+        if self.on_final:
+            await self.on_final(text, speech_ended_at)
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+
+class SpeculativeTurn:
+    """
+    Work started from a stable partial transcript before the user has
+    finished speaking. start() takes a factory returning named tasks; take()
+    hands them over when the final transcript matches the partial they were
+    started from, and cancels them otherwise.
+    """
+
+    def __init__(self):
+        self.key = ""
+        self.tasks: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def start(
+        self, text: str, factory: Callable[[str], Dict[str, asyncio.Future]]
+    ) -> bool:
+        key = normalize_transcript(text)
+        if not key or key == self.key:
+            return False
+        self.cancel()
+        self.key = key
+        self.tasks = factory(text)
+        return True
+
+    def take(self, text: str) -> Dict[str, asyncio.Future]:
+        if not self.key:
+            return {}
+        if normalize_transcript(text) != self.key:
+            self.misses += 1
+            self.cancel()
+            return {}
+        self.hits += 1
+        tasks = self.tasks
+        self.key, self.tasks = "", {}
+        return tasks
+
+    def cancel(self):
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+        self.key, self.tasks = "", {}
+
+    def get_stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "pending": bool(self.key)}
@@ -0,0 +1,568 @@
+"""
+SpeechSynthesis - Sentence-level TTS scheduling and audio caching for voice sessions
+
+Voice sessions speak an answer sentence by sentence as it streams from the
+thinker, but each sentence used to be synthesized only after the previous
+one had been sent, so every sentence boundary added a full TTS round trip of
+silence. Acknowledgements and fillers ("Sure, checking that now.") were
+synthesized again every time they were said.
+
+- `TTSProvider`: the synthesis contract, an async iterator of audio chunks
+  for one piece of text; `VoiceServerTTS` implements it over the voice
+  server's /v1/audio/speech(/stream) endpoints
+- `TTSScheduler`: plays queued sentences strictly in order while the next
+  `TTS_PREFETCH_SENTENCES` are synthesized in parallel; the sentence being
+  played streams as it is synthesized, the ones behind it buffer. cancel()
+  (barge-in) drops the queue and stops every pending synthesis
+- `AudioCache`: synthesized audio per (voice, language, format, text hash),
+  an LRU in memory in front of a size-bounded directory, shared by every
+  session in the process
+
+Usage:
+    scheduler = TTSScheduler(VoiceServerTTS(url, api_key), play=send_to_client)
+    item = scheduler.enqueue("Sure, checking that now.", voice="default")
+    await scheduler.wait(item)
+    scheduler.get_stats()  # per-stage timings and cache hit rate
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Sentences synthesized ahead of the one being played
+TTS_PREFETCH_SENTENCES = int(os.getenv("TTS_PREFETCH_SENTENCES", "2"))
+# Audio cache: memory and disk budgets, and the longest text worth caching
+# (acknowledgements and fillers recur, full answer sentences rarely do)
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR", os.path.join(os.getcwd(), "WORKSPACE", "tts_cache")
+)
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "256"))
+TTS_CACHE_MAX_TEXT = int(os.getenv("TTS_CACHE_MAX_TEXT", "160"))
+# Finished sentences kept for timing statistics
+TTS_STATS_HISTORY = int(os.getenv("TTS_STATS_HISTORY", "200"))
+
+# Size cached audio is replayed in, for formats that are streamed. Others
+# (WAV) are one complete blob per sentence and are replayed whole
+CACHE_CHUNK_SIZE = 4096
+STREAMING_FORMATS = ("pcm", "pcm_framed")
+
+
+class TTSProvider:
+    """Text in, audio chunks out, in the requested format."""
+
+    def synthesize(
+        self, text: str, voice: str, language: str, audio_format: str
+    ) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+
+class VoiceServerTTS(TTSProvider):
+    """
+    The voice server's OpenAI style speech endpoints: one WAV blob from
+    /v1/audio/speech, or streamed PCM from /v1/audio/speech/stream. "pcm"
+    output is unwrapped from the server's length-prefixed frames when it
+    sends them; "pcm_framed" passes them through.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "none",
+        client: Optional[Callable[[], httpx.AsyncClient]] = None,
+        timeout: float = 120.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or "none"
+        self.client = client
+        self.timeout = timeout
+
+    def _payload(self, text: str, voice: str, language: str, audio_format: str):
+        return {
+            "model": "tts-1",
+            "voice": voice,
+            "input": text,
+            "language": language,
+            "audio_format": audio_format,
+        }
+
+    async def synthesize(
+        self, text: str, voice: str, language: str, audio_format: str
+    ) -> AsyncIterator[bytes]:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        payload = self._payload(text, voice, language, audio_format)
+        owned = self.client is None
+        client = httpx.AsyncClient() if owned else self.client()
+        try:
+            if audio_format == "wav":
+                response = await client.post(
+                    self.base_url + "/v1/audio/speech",
+                    headers=headers,
+                    json=payload,
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                yield response.content
+                return
+            async with client.stream(
+                "POST",
+                self.base_url + "/v1/audio/speech/stream",
+                headers=headers,
+                json=payload,
+                timeout=self.timeout,
+            ) as response:
+                response.raise_for_status()
+                chunks = response.aiter_bytes(chunk_size=4096)
+                if audio_format != "pcm_framed":
+                    chunks = unframe_pcm(chunks)
+                async for chunk in chunks:
+                    if chunk:
+                        yield chunk
+        finally:
+            if owned:
+                await client.aclose()
+
+
+async def unframe_pcm(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Strip 4-byte little-endian length prefixes from a framed PCM stream.
+    A stream whose first "length" is implausible is raw PCM and passes
+    through unchanged.
+    """
+    buffer = bytearray()
+    framed_stream = None
+    max_frame_size = 2 * 1024 * 1024
+
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if framed_stream is False:
+            yield chunk
+            continue
+
+        buffer.extend(chunk)
+        while len(buffer) >= 4:
+            frame_size = struct.unpack("<I", buffer[:4])[0]
+            if frame_size == 0:
+                del buffer[:4]
+                continue
+            if frame_size > max_frame_size:
+                framed_stream = False
+                if buffer:
+                    yield bytes(buffer)
+                    buffer.clear()
+                break
+            if len(buffer) < frame_size + 4:
+                break
+            framed_stream = True
+            yield bytes(buffer[4 : frame_size + 4])
+            del buffer[: frame_size + 4]
+
+    if buffer:
+        if framed_stream is True:
+            logger.warning("Dropping incomplete framed TTS chunk")
+        else:
+            yield bytes(buffer)
+
+
+class AudioCache:
+    """
+    Synthesized audio keyed by voice, language, format and a hash of the
+    text. Recently used entries stay in memory; every entry is also written
+    to `directory`, whose least recently used files are removed once it
+    grows past its budget. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = TTS_CACHE_DIR,
+        memory_bytes: int = TTS_CACHE_MEMORY_MB * 2**20,
+        disk_bytes: int = TTS_CACHE_DISK_MB * 2**20,
+        max_text: int = TTS_CACHE_MAX_TEXT,
+    ):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_text = max_text
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk: "Optional[OrderedDict[str, int]]" = None
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def key(text: str, voice: str, language: str, audio_format: str) -> str:
+        material = "\0".join((voice, language, audio_format, text))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def cacheable(self, text: str) -> bool:
+        return 0 < len(text) <= self.max_text
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.audio")
+
+    def _load_disk(self):
+        """Index the cache directory once, least recently used first."""
+        if self._disk is not None or not self.directory:
+            return
+        self._disk = OrderedDict()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".audio"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-6], stat.st_size))
+        except OSError as e:
+            logger.warning(f"TTS cache directory unavailable: {e}")
+            self.directory = None
+            return
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return audio
+            self._load_disk()
+            if self._disk is None or key not in self._disk:
+                self.stats["misses"] += 1
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    audio = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                self._disk_size -= self._disk.pop(key)
+                self.stats["misses"] += 1
+                return None
+            self._disk.move_to_end(key)
+            self._remember(key, audio)
+            self.stats["disk_hits"] += 1
+            return audio
+
+    def set(self, key: str, audio: bytes):
+        if not audio or len(audio) > self.memory_bytes:
+            return
+        with self._lock:
+            self._remember(key, audio)
+            self.stats["stores"] += 1
+            self._load_disk()
+            if self._disk is None or key in self._disk:
+                return
+            path = self._path(key)
+            try:
+                with open(path + ".tmp", "wb") as f:
+                    f.write(audio)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                logger.warning(f"TTS cache write failed: {e}")
+                return
+            self._disk[key] = len(audio)
+            self._disk_size += len(audio)
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def _remember(self, key: str, audio: bytes):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = (
+                self.stats["memory_hits"]
+                + self.stats["disk_hits"]
+                + self.stats["misses"]
+            )
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk or ()),
+                "disk_bytes": self._disk_size,
+            }
+
+
+@dataclass
+class SpeechItem:
+    """One queued sentence and the monotonic time of each stage."""
+
+    text: str
+    voice: str
+    language: str
+    audio_format: str
+    queued_at: float = field(default_factory=time.monotonic)
+    synth_started_at: Optional[float] = None
+    first_chunk_at: Optional[float] = None
+    synth_done_at: Optional[float] = None
+    play_started_at: Optional[float] = None
+    first_sent_at: Optional[float] = None
+    play_done_at: Optional[float] = None
+    cached: bool = False
+    cancelled: bool = False
+    failed: bool = False
+    size: int = 0
+    task: Optional[asyncio.Task] = None
+    chunks: asyncio.Queue = field(default_factory=asyncio.Queue)
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def timings(self) -> dict:
+        """Milliseconds spent in each stage, None where a stage did not run."""
+
+        def span(start, end):
+            if start is None or end is None:
+                return None
+            return round((end - start) * 1000, 1)
+
+        return {
+            "queue_wait": span(self.queued_at, self.synth_started_at),
+            "synth_first_chunk": span(self.synth_started_at, self.first_chunk_at),
+            "synth_total": span(self.synth_started_at, self.synth_done_at),
+            "play_wait": span(self.queued_at, self.play_started_at),
+            "first_audio": span(self.play_started_at, self.first_sent_at),
+            "play": span(self.play_started_at, self.play_done_at),
+            "total": span(self.queued_at, self.play_done_at),
+        }
+
+
+PlayCallback = Callable[[SpeechItem, AsyncIterator[bytes]], Awaitable[None]]
+
+
+class TTSScheduler:
+    """
+    Ordered playback with synthesis running ahead.
+
+    play(item, chunks) is awaited for one item at a time, in enqueue order,
+    and sends the item's audio as `chunks` yields it. While it runs, the
+    next `ahead` items are already being synthesized (or read from the
+    cache), so their audio is ready when their turn comes.
+    """
+
+    def __init__(
+        self,
+        provider: TTSProvider,
+        play: PlayCallback,
+        ahead: int = TTS_PREFETCH_SENTENCES,
+        cache: Optional[AudioCache] = None,
+        history: int = TTS_STATS_HISTORY,
+    ):
+        self.provider = provider
+        self.play = play
+        self.ahead = max(0, ahead)
+        self.cache = cache
+        self._pending: Deque[SpeechItem] = deque()
+        self._player: Optional[asyncio.Task] = None
+        self._history: Deque[SpeechItem] = deque(maxlen=history)
+        self.stats = {
+            "queued": 0,
+            "played": 0,
+            "cancelled": 0,
+            "failed": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+        }
+        self._last_play_done: Optional[float] = None
+        self._gap_ms: Deque[float] = deque(maxlen=history)
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._pending)
+
+    def enqueue(
+        self,
+        text: str,
+        voice: str = "default",
+        language: str = "en",
+        audio_format: str = "pcm",
+    ) -> SpeechItem:
+        item = SpeechItem(text, voice, language, audio_format)
+        self._pending.append(item)
+        self.stats["queued"] += 1
+        self._fill()
+        if self._player is None or self._player.done():
+            self._player = asyncio.ensure_future(self._play_queue())
+        return item
+
+    async def wait(self, item: Optional[SpeechItem]) -> bool:
+        """Wait until item has been played; False if it was cancelled."""
+        if item is None:
+            return False
+        await item.done.wait()
+        return not item.cancelled
+
+    async def drain(self):
+        """Wait until everything queued so far has been played or cancelled."""
+        if self._pending:
+            await self._pending[-1].done.wait()
+
+    def cancel(self) -> int:
+        """Barge-in: stop playback and every pending synthesis."""
+        dropped = 0
+        while self._pending:
+            item = self._pending.popleft()
+            if item.task and not item.task.done():
+                item.task.cancel()
+            item.cancelled = True
+            item.done.set()
+            dropped += 1
+        if self._player and not self._player.done():
+            self._player.cancel()
+        self._player = None
+        self._last_play_done = None
+        self.stats["cancelled"] += dropped
+        return dropped
+
+    async def close(self):
+        self.cancel()
+
+    def _fill(self):
+        """Start synthesis for the playing item and the `ahead` behind it."""
+        for index, item in enumerate(self._pending):
+            if index > self.ahead:
+                break
+            if item.task is None:
+                item.task = asyncio.ensure_future(self._synthesize(item))
+
+    async def _synthesize(self, item: SpeechItem):
+        item.synth_started_at = time.monotonic()
+        key = None
+        try:
+            if self.cache and self.cache.cacheable(item.text):
+                key = self.cache.key(
+                    item.text, item.voice, item.language, item.audio_format
+                )
+                audio = await asyncio.to_thread(self.cache.get, key)
+                if audio is not None:
+                    item.cached = True
+                    self.stats["cache_hits"] += 1
+                    item.first_chunk_at = time.monotonic()
+                    if item.audio_format in STREAMING_FORMATS:
+                        for start in range(0, len(audio), CACHE_CHUNK_SIZE):
+                            item.chunks.put_nowait(
+                                audio[start : start + CACHE_CHUNK_SIZE]
+                            )
+                    else:
+                        item.chunks.put_nowait(audio)
+                    item.size = len(audio)
+                    return
+                self.stats["cache_misses"] += 1
+            audio: List[bytes] = []
+            async for chunk in self.provider.synthesize(
+                item.text, item.voice, item.language, item.audio_format
+            ):
+                if not chunk:
+                    continue
+                if item.first_chunk_at is None:
+                    item.first_chunk_at = time.monotonic()
+                audio.append(chunk)
+                item.size += len(chunk)
+                item.chunks.put_nowait(chunk)
+            if key and audio:
+                await asyncio.to_thread(self.cache.set, key, b"".join(audio))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            item.failed = True
+            self.stats["failed"] += 1
+            logger.error(f"TTS synthesis failed for '{item.text[:60]}': {e}")
+        finally:
+            item.synth_done_at = time.monotonic()
+            item.chunks.put_nowait(None)
+
+    async def _chunks(self, item: SpeechItem) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await item.chunks.get()
+            if chunk is None:
+                return
+            if item.first_sent_at is None:
+                item.first_sent_at = time.monotonic()
+            yield chunk
+
+    async def _play_queue(self):
+        while self._pending:
+            item = self._pending[0]
+            item.play_started_at = time.monotonic()
+            try:
+                await self.play(item, self._chunks(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"TTS playback failed: {e}")
+            item.play_done_at = time.monotonic()
+            # Silence the listener hears between the previous sentence and this one
+            if self._last_play_done is not None and item.first_sent_at is not None:
+                gap = (item.first_sent_at - self._last_play_done) * 1000
+                self._gap_ms.append(max(0.0, gap))
+            self._last_play_done = item.play_done_at
+            if self._pending and self._pending[0] is item:
+                self._pending.popleft()
+            if not item.failed:
+                self.stats["played"] += 1
+            self._history.append(item)
+            item.done.set()
+            self._fill()
+        self._last_play_done = None
+
+    def get_stats(self) -> dict:
+        """Counters, cache hit rate and p50/p95 of each stage in milliseconds."""
+        stages = {}
+        timings = [item.timings() for item in self._history]
+        names = timings[0].keys() if timings else ()
+        for name in names:
+            values = sorted(t[name] for t in timings if t[name] is not None)
+            if values:
+                stages[name] = {
+                    "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                }
+        gaps = sorted(self._gap_ms)
+        if gaps:
+            stages["gap_between_sentences"] = {
+                "p50": round(gaps[len(gaps) // 2], 1),
+                "p95": round(gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))], 1),
+            }
+        lookups = self.stats["cache_hits"] + self.stats["cache_misses"]
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "cache_hit_rate": (
+                round(self.stats["cache_hits"] / lookups, 3) if lookups else 0.0
+            ),
+            "stages": stages,
+        }
+
+
+# Shared by every voice session in the process
+tts_audio_cache = AudioCache()
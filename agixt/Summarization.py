@@ -0,0 +1,239 @@
+"""
+Summarization - Concurrent map-reduce summaries of long text
+
+Summarizing chunk by chunk costs one LLM round trip per chunk, back to back.
+`MapReduceSummarizer` instead:
+
+- splits the text into chunks in document order (Memories.chunk_content, or a
+  plain paragraph splitter);
+- summarizes the chunks concurrently, at most `concurrency` calls at a time;
+- reduces the partial summaries in groups, level by level, until the result
+  fits the token budget;
+- caches every partial summary in SharedCache under a hash of its input, so a
+  document summarized again, or a new version sharing most of its chunks,
+  only pays for the parts that changed.
+
+Every LLM call is counted in SummaryUsage so callers can report token usage.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# (text, stage) -> summary, where stage is "map" for a chunk of the source
+# and "reduce" for a group of partial summaries
+SummarizeFunction = Callable[[str, str], Awaitable[str]]
+
+# (text, chunk_size in tokens) -> chunks in document order
+Chunker = Callable[[str, int], Awaitable[List[str]]]
+
+DEFAULT_SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+SUMMARY_CACHE_TTL = 7 * 86400
+
+# Reduce passes before giving up on reaching the budget
+MAX_REDUCE_LEVELS = 6
+
+SEPARATOR = "\n\n"
+
+
+@dataclass
+class SummaryUsage:
+    calls: int = 0
+    cache_hits: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # Input tokens that were not sent again because of the cache
+    cached_input_tokens: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class SummaryResult:
+    summary: str
+    chunks: int
+    levels: int
+    usage: SummaryUsage
+
+    def to_dict(self) -> dict:
+        return {
+            "summary": self.summary,
+            "chunks": self.chunks,
+            "levels": self.levels,
+            "usage": self.usage.to_dict(),
+        }
+
+
+def _default_count_tokens(text: str) -> int:
+    from Globals import get_tokens
+
+    return get_tokens(text)
+
+
+def split_by_tokens(
+    text: str, chunk_size: int, count_tokens: Callable[[str], int]
+) -> List[str]:
+    """Pack paragraphs (or, for oversized ones, words) into chunks in order"""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= chunk_size:
+            pieces.append(paragraph)
+            continue
+        words = paragraph.split()
+        # Tokens per word varies; split on the measured ratio for the paragraph
+        per_chunk = max(1, int(len(words) * chunk_size / count_tokens(paragraph)))
+        for start in range(0, len(words), per_chunk):
+            pieces.append(" ".join(words[start : start + per_chunk]))
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > chunk_size:
+            chunks.append(SEPARATOR.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(SEPARATOR.join(current))
+    return chunks
+
+
+class MapReduceSummarizer:
+    """
+    Summarize text of any length within a token budget.
+
+    `summarize` is the LLM call. `cache_namespace` should identify whatever
+    changes the output for the same input (agent, prompt, model), since
+    partial summaries are shared by everything using the same namespace.
+    """
+
+    def __init__(
+        self,
+        summarize: SummarizeFunction,
+        chunker: Optional[Chunker] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        chunk_size: int = 2000,
+        concurrency: int = DEFAULT_SUMMARY_CONCURRENCY,
+        cache=None,
+        cache_namespace: str = "default",
+    ):
+        self.summarize = summarize
+        self.count_tokens = count_tokens or _default_count_tokens
+        self.chunker = chunker or self._split
+        self.chunk_size = max(1, int(chunk_size))
+        self.concurrency = max(1, concurrency)
+        self.cache = cache or shared_cache
+        self.cache_namespace = cache_namespace
+
+    async def _split(self, text: str, chunk_size: int) -> List[str]:
+        return split_by_tokens(text, chunk_size, self.count_tokens)
+
+    def _cache_key(self, stage: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"summary:{self.cache_namespace}:{stage}:{digest}"
+
+    async def _summarize_piece(
+        self,
+        stage: str,
+        text: str,
+        usage: SummaryUsage,
+        semaphore: asyncio.Semaphore,
+    ) -> str:
+        key = self._cache_key(stage, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            usage.cache_hits += 1
+            usage.cached_input_tokens += self.count_tokens(text)
+            return cached
+        async with semaphore:
+            summary = await self.summarize(text, stage)
+        summary = (summary or "").strip()
+        usage.calls += 1
+        usage.input_tokens += self.count_tokens(text)
+        usage.output_tokens += self.count_tokens(summary)
+        if summary:
+            self.cache.set(key, summary, ttl=SUMMARY_CACHE_TTL)
+        return summary
+
+    def _group(self, summaries: List[str]) -> List[List[str]]:
+        """Consecutive summaries that fit one chunk; at least two per group"""
+        groups: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for summary in summaries:
+            tokens = self.count_tokens(summary)
+            if len(current) >= 2 and current_tokens + tokens > self.chunk_size:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += tokens
+        if current:
+            if len(current) == 1 and groups:
+                groups[-1].append(current[0])
+            else:
+                groups.append(current)
+        return groups
+
+    async def run(self, text: str, token_budget: Optional[int] = None) -> SummaryResult:
+        """
+        Summarize `text`, reducing until the summary is at most `token_budget`
+        tokens (default: one chunk). Partial summaries keep document order.
+        """
+        budget = token_budget or self.chunk_size
+        usage = SummaryUsage()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        chunks = [chunk for chunk in await self.chunker(text, self.chunk_size) if chunk]
+        summaries = await asyncio.gather(
+            *[self._summarize_piece("map", chunk, usage, semaphore) for chunk in chunks]
+        )
+        summaries = [summary for summary in summaries if summary]
+        levels = 0
+        while summaries and levels < MAX_REDUCE_LEVELS:
+            total = self.count_tokens(SEPARATOR.join(summaries))
+            if total <= budget:
+                break
+            levels += 1
+            if len(summaries) == 1:
+                condensed = await self._summarize_piece(
+                    "reduce", summaries[0], usage, semaphore
+                )
+                if not condensed or self.count_tokens(condensed) >= total:
+                    # The model cannot shorten it further; keep what we have
+                    break
+                summaries = [condensed]
+                continue
+            reduced = await asyncio.gather(
+                *[
+                    self._summarize_piece(
+                        "reduce", SEPARATOR.join(group), usage, semaphore
+                    )
+                    for group in self._group(summaries)
+                ]
+            )
+            summaries = [summary for summary in reduced if summary]
+        if usage.calls or usage.cache_hits:
+            logger.info(
+                f"Summarized {len(chunks)} chunks in {levels} reduce levels: "
+                f"{usage.calls} calls, {usage.input_tokens} input and "
+                f"{usage.output_tokens} output tokens, {usage.cache_hits} cached"
+            )
+        return SummaryResult(
+            summary=SEPARATOR.join(summaries),
+            chunks=len(chunks),
+            levels=levels,
+            usage=usage,
+        )
@@ -44,6 +44,7 @@ except ImportError as e:
 except Exception as e:
     logging.warning(f"Failed to load botbuilder-core library: {e}")
 
+from BotRuntime import BotRuntime
 from DB import get_session, CompanyExtensionSetting, Company
 from Globals import getenv
 from MagicalAuth import impersonate_user
@@ -653,6 +654,8 @@ class TeamsBotManager:
         self._tasks: Dict[str, asyncio.Task] = {}
         self._running = False
         self._monitor_task: Optional[asyncio.Task] = None
+        # Set when bots are owned through the sharded BotRuntime
+        self.runtime: Optional[BotRuntime] = None
 
     def get_server_bot_credentials(self) -> tuple:
         """Get the server-level Teams bot credentials."""
@@ -704,12 +707,14 @@ class TeamsBotManager:
 
         return app_id, app_password
 
-    def get_company_bot_config(self) -> Dict[str, Dict[str, str]]:
-        """Get Teams bot configuration for all companies."""
+    def get_company_bot_config(
+        self, company_id: str = None
+    ) -> Dict[str, Dict[str, str]]:
+        """Get Teams bot configuration for all companies, or for one."""
         configs = {}
 
         with get_session() as db:
-            settings = (
+            query = (
                 db.query(CompanyExtensionSetting)
                 .filter(CompanyExtensionSetting.extension_name == "teams")
                 .filter(
@@ -724,8 +729,10 @@ class TeamsBotManager:
                         ]
                     )
                 )
-                .all()
             )
+            if company_id:
+                query = query.filter(CompanyExtensionSetting.company_id == company_id)
+            settings = query.all()
 
             for setting in settings:
                 company_id = str(setting.company_id)
@@ -768,6 +775,37 @@ class TeamsBotManager:
 
         return configs
 
+    def is_bot_runnable(self, config: Dict[str, str]) -> bool:
+        """Whether a company config is enabled and has both credentials."""
+        return bool(
+            (config.get("enabled") or "").lower() == "true"
+            and config.get("app_id")
+            and config.get("app_password")
+        )
+
+    def get_server_bot_config(self) -> Optional[Dict[str, str]]:
+        """Config of the server-level bot shared by all companies, if any."""
+        app_id, app_password = self.get_server_bot_credentials()
+        if not (app_id and app_password):
+            return None
+        return {
+            "name": "AGiXT Server Bot",
+            "app_id": app_id,
+            "app_password": app_password,
+        }
+
+    async def start_bot_from_config(self, bot_id: str, config: Dict[str, str]) -> bool:
+        """Start a bot from a get_company_bot_config / get_server_bot_config entry."""
+        return await self.start_bot_for_company(
+            bot_id,
+            config["name"],
+            config["app_id"],
+            config["app_password"],
+            bot_agent_id=config.get("bot_agent_id"),
+            bot_permission_mode=config.get("bot_permission_mode") or "recognized_users",
+            bot_owner_id=config.get("bot_owner_id"),
+        )
+
     async def start_bot_for_company(
         self,
         company_id: str,
@@ -857,10 +895,7 @@ class TeamsBotManager:
         company_configs = self.get_company_bot_config()
 
         company_bots_configured = any(
-            config.get("enabled", "").lower() == "true"
-            and config.get("app_id")
-            and config.get("app_password")
-            for config in company_configs.values()
+            self.is_bot_runnable(config) for config in company_configs.values()
         )
 
         if company_bots_configured:
@@ -882,23 +917,8 @@ class TeamsBotManager:
                 await self.stop_bot_for_company(company_id)
 
             for company_id, config in company_configs.items():
-                if (
-                    config.get("enabled", "").lower() == "true"
-                    and config.get("app_id")
-                    and config.get("app_password")
-                    and company_id not in self.bots
-                ):
-                    await self.start_bot_for_company(
-                        company_id,
-                        config["name"],
-                        config["app_id"],
-                        config["app_password"],
-                        bot_agent_id=config.get("bot_agent_id"),
-                        bot_permission_mode=config.get(
-                            "bot_permission_mode", "recognized_users"
-                        ),
-                        bot_owner_id=config.get("bot_owner_id"),
-                    )
+                if self.is_bot_runnable(config) and company_id not in self.bots:
+                    await self.start_bot_from_config(company_id, config)
 
         elif server_app_id and server_app_password:
             for company_id in list(self.bots.keys()):
@@ -1002,7 +1022,10 @@ async def start_teams_bot_manager():
 
     if _manager is None:
         _manager = TeamsBotManager()
-    await _manager.start()
+    # Bots hashed to this worker, started and restarted on config events
+    if _manager.runtime is None:
+        _manager.runtime = BotRuntime("teams", _manager)
+    await _manager.runtime.start()
     return _manager
 
 
@@ -1010,5 +1033,7 @@ async def stop_teams_bot_manager():
     """Stop the global Teams bot manager."""
     global _manager
     if _manager:
+        if _manager.runtime is not None:
+            await _manager.runtime.stop()
         await _manager.stop()
         _manager = None
@@ -40,6 +40,14 @@ from Globals import getenv
 from MagicalAuth import impersonate_user
 from InternalClient import InternalClient
 from Models import ChatCompletions
+from BotRuntime import CompanyInbox
+from BotPipeline import (
+    ConversationPipeline,
+    InboundMessage,
+    StreamingReply,
+    iter_stream_content,
+    platform_users,
+)
 
 
 def get_telegram_user_ids(company_id=None):
@@ -173,6 +181,10 @@ class CompanyTelegramBot:
         # Cache of Telegram user IDs to AGiXT user IDs
         self._user_id_cache: Dict[str, str] = {}
 
+        # Updates are handled per chat in order, bursts as one agent turn
+        self.inbox = CompanyInbox(company_id)
+        self.pipeline = ConversationPipeline(self._handle_inbound, inbox=self.inbox)
+
         logger.info(
             f"Initialized Telegram bot for company {company_name} ({company_id})"
         )
@@ -313,9 +325,71 @@ class CompanyTelegramBot:
 
     def _get_agixt_user_id(self, telegram_user_id: str) -> Optional[str]:
         """Get the AGiXT user ID for a Telegram user."""
-        if telegram_user_id not in self._user_id_cache:
+        if telegram_user_id in self._user_id_cache:
+            return self._user_id_cache[telegram_user_id]
+
+        def refresh():
             self._refresh_user_id_cache()
-        return self._user_id_cache.get(telegram_user_id)
+            return self._user_id_cache.get(telegram_user_id)
+
+        # Unlinked users only refresh the mapping once per miss TTL
+        return platform_users.get_or_load(
+            ("telegram", self.company_id, "user", telegram_user_id), refresh
+        )
+
+    def _get_user_email(self, agixt_user_id: str) -> Optional[str]:
+        """Get the email of an AGiXT user, shared across bots for the lookup TTL."""
+
+        def load():
+            from DB import User
+
+            with get_session() as session:
+                user = session.query(User).filter(User.id == agixt_user_id).first()
+                return user.email if user else None
+
+        return platform_users.get_or_load(("agixt", "email", agixt_user_id), load)
+
+    def _get_company_user_id(self) -> Optional[str]:
+        """A user of this company, who answers guests when the bot has no owner."""
+
+        def load():
+            from DB import UserCompany
+
+            with get_session() as session:
+                membership = (
+                    session.query(UserCompany)
+                    .filter(UserCompany.company_id == self.company_id)
+                    .first()
+                )
+                return str(membership.user_id) if membership else None
+
+        return platform_users.get_or_load(
+            ("agixt", "company_user", self.company_id), load
+        )
+
+    def _to_inbound(self, message: dict) -> Optional[InboundMessage]:
+        """Normalize a Telegram message; None for messages without text."""
+        chat_id = message.get("chat", {}).get("id")
+        text = message.get("text", "")
+        if not text or not chat_id:
+            return None
+        user_id = str(message.get("from", {}).get("id", ""))
+        return InboundMessage(
+            platform="telegram",
+            company_id=self.company_id,
+            conversation_key=f"{chat_id}:{user_id}",
+            user_id=user_id,
+            text=text,
+            channel_id=str(chat_id),
+            message_id=str(message.get("message_id", "")),
+            reply_to=str(message.get("message_id", "")),
+            is_command=text.startswith("/"),
+            raw=message,
+        )
+
+    async def _handle_inbound(self, message: InboundMessage):
+        """Handle one turn of the pipeline (one message or a merged burst)."""
+        await self._process_message({**message.raw, "text": message.text})
 
     async def _get_user_token(self, telegram_user_id: str) -> Optional[str]:
         """Get an impersonation token for a user."""
@@ -614,22 +688,34 @@ class CompanyTelegramBot:
                 if not agent_name:
                     agent_name = await self._get_default_agent()
 
-            # Try to get user's token
-            user_token = None
-            if use_owner_context and self.bot_owner_id:
-                user_token = impersonate_user(self.bot_owner_id)
-            else:
-                user_token = await self._get_user_token(user_id)
+            # Run the turn as the linked user, or as the owner for guests
+            # (falling back to a company user when the bot has no owner)
+            acting_user_id = self.bot_owner_id if use_owner_context else agixt_user_id
+            if use_owner_context and not acting_user_id:
+                acting_user_id = self._get_company_user_id()
+            user_email = (
+                self._get_user_email(acting_user_id) if acting_user_id else None
+            )
+            if not user_email:
+                logger.error(
+                    f"No AGiXT user to answer Telegram user {user_id} "
+                    f"for company {self.company_id}"
+                )
+                await self._send_message(
+                    chat_id,
+                    "Sorry, I'm having trouble connecting to my AI backend.",
+                    message_id,
+                )
+                return
+            user_token = impersonate_user(user_email)
 
             # Build conversation name
             conversation_name = f"telegram-{user_id}-{self.company_id[:8]}"
 
             # If bot has configured agent, resolve agent name
-            if self.bot_agent_id and user_token:
+            if self.bot_agent_id:
                 try:
-                    from InternalClient import InternalClient
-
-                    agixt = InternalClient(api_key=user_token)
+                    agixt = InternalClient(api_key=user_token, user=user_email)
                     agents = agixt.get_agents()
                     for agent in agents:
                         if isinstance(agent, dict) and str(agent.get("id")) == str(
@@ -641,89 +727,57 @@ class CompanyTelegramBot:
                         logger.warning(
                             f"Configured bot agent ID {self.bot_agent_id} not found, using default"
                         )
-                        agent_name = await self._get_default_agent()
                 except Exception as e:
                     logger.warning(f"Could not lookup configured agent: {e}")
+                if not agent_name:
                     agent_name = await self._get_default_agent()
 
-            if user_token:
-                chat = ChatCompletions(
-                    agent_name=agent_name,
-                    api_key=user_token,
-                )
-            else:
-                with get_session() as session:
-                    from DB import User
+            from XT import AGiXT
 
-                    user = (
-                        session.query(User)
-                        .filter_by(company_id=self.company_id)
-                        .first()
-                    )
-                    if user:
-                        default_token = impersonate_user(str(user.id))
-                        # If bot has configured agent, resolve agent name
-                        if self.bot_agent_id and not agent_name:
-                            try:
-                                from InternalClient import InternalClient
-
-                                agixt = InternalClient(api_key=default_token)
-                                agents = agixt.get_agents()
-                                for agent in agents:
-                                    if isinstance(agent, dict) and str(
-                                        agent.get("id")
-                                    ) == str(self.bot_agent_id):
-                                        agent_name = agent.get("name", "XT")
-                                        break
-                                if not agent_name:
-                                    agent_name = await self._get_default_agent()
-                            except Exception as e:
-                                logger.warning(
-                                    f"Could not lookup configured agent: {e}"
-                                )
-                                agent_name = await self._get_default_agent()
-                        chat = ChatCompletions(
-                            agent_name=agent_name,
-                            api_key=default_token,
-                        )
-                    else:
-                        logger.error(f"No users found for company {self.company_id}")
-                        await self._send_message(
-                            chat_id,
-                            "Sorry, I'm having trouble connecting to my AI backend.",
-                            message_id,
-                        )
-                        return
-
-            # Generate response
-            response = await chat.chat_completions(
-                messages=[{"role": "user", "content": text}],
+            agixt_instance = AGiXT(
+                user=user_email,
+                agent_name=agent_name,
+                api_key=user_token,
                 conversation_name=conversation_name,
-                context_results=10,
+            )
+            chat_prompt = ChatCompletions(
+                model=agent_name,
+                user=conversation_name,
+                messages=[{"role": "user", "content": text}],
+                stream=True,
             )
 
-            if response and isinstance(response, dict):
-                content = (
-                    response.get("choices", [{}])[0]
-                    .get("message", {})
-                    .get("content", "")
+            # Send the reply as it streams in and edit it as tokens arrive
+            async def post(reply_text):
+                result = await asyncio.to_thread(
+                    self._make_request,
+                    "sendMessage",
+                    {
+                        "chat_id": chat_id,
+                        "text": reply_text,
+                        "reply_to_message_id": message_id,
+                    },
                 )
-                if content:
-                    # Convert markdown to HTML for Telegram
-                    content = content.replace("**", "<b>").replace("__", "<i>")
-                    await self._send_message(chat_id, content, message_id)
-                else:
-                    await self._send_message(
-                        chat_id,
-                        "I apologize, but I couldn't generate a response.",
-                        message_id,
+                return result.get("message_id") if result else None
+
+            async def update(reply_message_id, reply_text):
+                if reply_message_id:
+                    await asyncio.to_thread(
+                        self._make_request,
+                        "editMessageText",
+                        {
+                            "chat_id": chat_id,
+                            "message_id": reply_message_id,
+                            "text": reply_text,
+                        },
                     )
-            else:
-                await self._send_message(
-                    chat_id,
-                    "I apologize, but I couldn't generate a response.",
-                    message_id,
-                )
+
+            reply = StreamingReply(send=post, edit=update, max_length=4096)
+            async for delta in iter_stream_content(
+                agixt_instance.chat_completions_stream(prompt=chat_prompt)
+            ):
+                await reply.push(delta)
+            await reply.finish("I apologize, but I couldn't generate a response.")
 
         except Exception as e:
             logger.error(f"Error processing message: {e}")
@@ -747,7 +801,9 @@ class CompanyTelegramBot:
                             self.last_update_id = update_id
 
                         if "message" in update:
-                            await self._process_message(update["message"])
+                            message = self._to_inbound(update["message"])
+                            if message is not None:
+                                self.pipeline.submit(message)
 
                 # Small delay between polls
                 await asyncio.sleep(0.5)
@@ -785,6 +841,8 @@ class CompanyTelegramBot:
         if self._unsaved_message_count > 0:
             self._save_messages_processed()
         self.is_running = False
+        await self.pipeline.close()
+        await self.inbox.close()
 
     def get_status(self) -> TelegramBotStatus:
         """Get current bot status."""
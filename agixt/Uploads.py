@@ -0,0 +1,320 @@
+"""
+Uploads - Request bodies streamed to disk without blocking the event loop
+
+The audio transcription routes read each upload with `file.file.read()` and
+wrote it with `open().write()` inside async handlers, and the learn-file
+routes took the whole document base64-encoded in a JSON body. A few large
+recordings or documents at once held their full size in memory and stalled
+every other request on the worker while they were copied.
+
+- `receive_upload` reads an UploadFile, a Request body or any async
+  iterator of bytes in UPLOAD_CHUNK_SIZE batches into a `SpooledUpload`.
+  Writes and the sha256 of the content run in a worker thread, one batch
+  in flight while the next is received, so the loop only moves bytes
+  between buffers. The size limit is checked as bytes arrive (and against
+  Content-Length before any are read) and answers 413.
+- `SpooledUpload` keeps small bodies in memory and rolls larger ones over to
+  a temporary file in the spool directory. Downstream processors get
+  `file`, a handle positioned at the start, or `save(path)`, which moves a
+  spooled file into place instead of copying it when it can.
+- `find_duplicate` / `remember_upload` keep the content hashes of what was
+  already stored in a directory, so a document uploaded again is not
+  extracted and embedded a second time. A match only counts while the
+  stored file still has that content; callers drop entries whose learned
+  memories are gone with `forget_upload`.
+
+Usage:
+    upload = await receive_upload(request)
+    if await find_duplicate(directory, upload.sha256) is None:
+        path = await upload.save(os.path.join(directory, file_name))
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Largest accepted upload
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "1024")) * 1024 * 1024
+
+# Bytes gathered before one threaded write; bounds the memory of an upload
+# in flight to about twice this
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
+
+# Bodies up to this size never touch disk until they are saved
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_KB", "1024")) * 1024
+
+# Where larger bodies are spooled; on the same filesystem as the workspace
+# so saving them is a rename
+UPLOAD_SPOOL_DIR = os.path.join(os.getcwd(), "WORKSPACE", "uploads")
+
+# Content hashes of stored uploads, kept next to them
+UPLOAD_INDEX_FILE = ".upload_hashes.json"
+
+_index_lock = threading.Lock()
+
+
+def is_reserved_upload_name(file_name: str) -> bool:
+    """Names uploads may not take: the hash index and its temporary files."""
+    return file_name == UPLOAD_INDEX_FILE or file_name.startswith(
+        f"{UPLOAD_INDEX_FILE}."
+    )
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Upload exceeds the maximum size of {limit // (1024 * 1024)}MB",
+    )
+
+
+class SpooledUpload:
+    """
+    An upload's content, in memory up to `spool_bytes` and then in a
+    temporary file under `spool_dir`.
+    """
+
+    def __init__(
+        self,
+        filename: str = "",
+        content_type: str = "application/octet-stream",
+        spool_bytes: int = UPLOAD_SPOOL_BYTES,
+        spool_dir: str = UPLOAD_SPOOL_DIR,
+    ):
+        self.filename = filename
+        self.content_type = content_type
+        self.spool_bytes = spool_bytes
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.spool_path: Optional[str] = None
+        self.file = io.BytesIO()
+        self._hash = hashlib.sha256()
+        self.sha256 = ""
+
+    @property
+    def in_memory(self) -> bool:
+        return self.spool_path is None
+
+    def _write(self, data: bytes):
+        """Runs in a worker thread; hashlib releases the GIL on large buffers."""
+        self._hash.update(data)
+        if self.in_memory and self.file.tell() + len(data) > self.spool_bytes:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            fd, self.spool_path = tempfile.mkstemp(
+                prefix="upload-", suffix=".part", dir=self.spool_dir
+            )
+            spooled = os.fdopen(fd, "w+b")
+            spooled.write(self.file.getbuffer())
+            self.file = spooled
+        self.file.write(data)
+
+    def _finish(self):
+        self.file.flush()
+        self.file.seek(0)
+        self.sha256 = self._hash.hexdigest()
+
+    async def read(self) -> bytes:
+        """The whole content; for callers that need bytes, e.g. small files."""
+        if self.in_memory:
+            return self.file.getvalue()
+        self.file.seek(0)
+        return await asyncio.to_thread(self.file.read)
+
+    async def save(self, path: str) -> str:
+        """Store the content at `path` and close the upload."""
+        await asyncio.to_thread(self._save, path)
+        return path
+
+    def _save(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if self.in_memory:
+            partial = f"{path}.{os.getpid()}.part"
+            with open(partial, "wb") as f:
+                f.write(self.file.getbuffer())
+            os.replace(partial, path)
+        else:
+            self.file.close()
+            shutil.move(self.spool_path, path)
+            self.spool_path = None
+        self.close()
+
+    def close(self):
+        try:
+            self.file.close()
+        except Exception:
+            pass
+        if self.spool_path:
+            try:
+                os.remove(self.spool_path)
+            except OSError:
+                pass
+            self.spool_path = None
+
+
+async def _chunks(source) -> AsyncIterator[bytes]:
+    # Request
+    if hasattr(source, "stream"):
+        async for chunk in source.stream():
+            yield chunk
+    # UploadFile: reads are threaded by Starlette once its spool is on disk
+    elif hasattr(source, "read") and hasattr(source, "file"):
+        while chunk := await source.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+
+def _declared_size(source) -> Optional[int]:
+    size = getattr(source, "size", None)
+    if size is not None:
+        return size
+    headers = getattr(source, "headers", None)
+    if headers is not None and headers.get("content-length", "").isdigit():
+        return int(headers["content-length"])
+    return None
+
+
+async def receive_upload(
+    source,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+    filename: Optional[str] = None,
+    content_type: Optional[str] = None,
+    spool_bytes: int = UPLOAD_SPOOL_BYTES,
+    spool_dir: str = UPLOAD_SPOOL_DIR,
+) -> SpooledUpload:
+    """
+    Stream `source` (UploadFile, Request or async iterator of bytes) into a
+    SpooledUpload. Raises HTTPException 413 once more than `max_bytes` have
+    arrived, or before reading when the declared size is already too large.
+    """
+    declared = _declared_size(source)
+    if declared is not None and declared > max_bytes:
+        raise _too_large(max_bytes)
+    headers = getattr(source, "headers", None) or {}
+    upload = SpooledUpload(
+        filename=filename or getattr(source, "filename", None) or "",
+        content_type=content_type
+        or getattr(source, "content_type", None)
+        or headers.get("content-type")
+        or "application/octet-stream",
+        spool_bytes=spool_bytes,
+        spool_dir=spool_dir,
+    )
+    buffer = bytearray()
+    writing: Optional[asyncio.Future] = None
+    try:
+        async for chunk in _chunks(source):
+            upload.size += len(chunk)
+            if upload.size > max_bytes:
+                raise _too_large(max_bytes)
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                if writing:
+                    await writing
+                writing = asyncio.ensure_future(
+                    asyncio.to_thread(upload._write, bytes(buffer))
+                )
+                buffer.clear()
+        if writing:
+            await writing
+        if buffer:
+            await asyncio.to_thread(upload._write, bytes(buffer))
+        upload._finish()
+    except BaseException:
+        if writing and not writing.done():
+            # The thread finishes its write; wait so the file can be removed
+            await asyncio.shield(writing)
+        upload.close()
+        raise
+    return upload
+
+
+def _read_index(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, UPLOAD_INDEX_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(directory: str, index: dict):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, UPLOAD_INDEX_FILE)
+    with open(f"{path}.{os.getpid()}.part", "w") as f:
+        json.dump(index, f)
+    os.replace(f"{path}.{os.getpid()}.part", path)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _find_duplicate(directory: str, sha256: str) -> Optional[str]:
+    entry = _read_index(directory).get(sha256)
+    if isinstance(entry, str):
+        entry = {"file": entry}
+    if not isinstance(entry, dict) or not entry.get("file"):
+        return None
+    path = os.path.join(directory, entry["file"])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    unchanged = (stat.st_size, stat.st_mtime_ns) == (
+        entry.get("size"),
+        entry.get("mtime_ns"),
+    )
+    # The file may have been replaced by other content under the same name
+    if unchanged or _file_sha256(path) == sha256:
+        return entry["file"]
+    return None
+
+
+def _remember_upload(directory: str, sha256: str, file_name: str):
+    stat = os.stat(os.path.join(directory, file_name))
+    with _index_lock:
+        index = _read_index(directory)
+        index[sha256] = {
+            "file": file_name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        _write_index(directory, index)
+
+
+def _forget_upload(directory: str, sha256: str):
+    with _index_lock:
+        index = _read_index(directory)
+        if index.pop(sha256, None) is not None:
+            _write_index(directory, index)
+
+
+async def find_duplicate(directory: str, sha256: str) -> Optional[str]:
+    """Name of a file already stored in `directory` with this content, if any."""
+    return await asyncio.to_thread(_find_duplicate, directory, sha256)
+
+
+async def remember_upload(directory: str, sha256: str, file_name: str):
+    """Record that `file_name` in `directory` has content hash `sha256`."""
+    await asyncio.to_thread(_remember_upload, directory, sha256, file_name)
+
+
+async def forget_upload(directory: str, sha256: str):
+    """Drop the entry for `sha256`, e.g. once its learned memories are deleted."""
+    await asyncio.to_thread(_forget_upload, directory, sha256)
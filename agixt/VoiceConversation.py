@@ -6,7 +6,6 @@ import uuid
 import base64
 import asyncio
 import logging
-import struct
 import httpx
 from enum import Enum
 from typing import Optional, Dict, List
@@ -16,6 +15,18 @@ from Conversations import (
     Conversations,
     get_conversation_id_by_name,
 )
+from SpeechStream import (
+    STT_SAMPLE_RATE,
+    SpeculativeTurn,
+    StreamingTranscriber,
+    VoiceServerSTT,
+)
+from SpeechSynthesis import (
+    SpeechItem,
+    TTSScheduler,
+    VoiceServerTTS,
+    tts_audio_cache,
+)
 
 
 class VoiceState(str, Enum):
@@ -41,6 +52,8 @@ class VoiceConversationSession:
     - Thinker activity events (thinking, searching, executing) drive informed narration
     - Mid-conversation user speech is injected as steering context for thinker
     - Answer tokens stream to TTS as they arrive (no wait-then-monologue)
+    - Streamed audio is transcribed while the user speaks; stable partials
+      start the speaker's triage before the utterance ends
     - All I/O is async (httpx), no blocking thread pool calls
     """
 
@@ -70,7 +83,6 @@ class VoiceConversationSession:
         self.ability_model = getenv("ABILITY_SELECTION_MODEL")
 
         # Cancellation
-        self._speaker_task: Optional[asyncio.Task] = None
         self._thinker_task: Optional[asyncio.Task] = None
         self._cancelled = False
 
@@ -116,6 +128,35 @@ class VoiceConversationSession:
         # Shared httpx client for STT/TTS (connection pooling)
         self._http_client: Optional[httpx.AsyncClient] = None
 
+        # STT: batch provider for complete recordings, and the incremental
+        # transcriber used when the client streams raw PCM
+        self.stt_provider = VoiceServerSTT(
+            self.voice_server or "",
+            api_key=self._voice_api_key(),
+            client=self._get_http_client,
+        )
+        self._transcriber: Optional[StreamingTranscriber] = None
+        self._on_transcript = None
+
+        # TTS: sentences are synthesized ahead of playback, and short
+        # recurring phrases come from the process-wide audio cache
+        self.tts = TTSScheduler(
+            VoiceServerTTS(
+                self.voice_server or "",
+                api_key=self._voice_api_key(),
+                client=self._get_http_client,
+            ),
+            play=self._play_speech,
+            cache=tts_audio_cache,
+        )
+
+        # Triage started from a stable partial transcript
+        self._speculation = SpeculativeTurn()
+
+        # End of the user's speech, until the first audio of the reply is sent
+        self._speech_ended_at: Optional[float] = None
+        self.last_first_audio_latency: Optional[float] = None
+
         # Conversation helper (lazy-initialized)
         self._conversations: Optional[Conversations] = None
 
@@ -202,6 +243,14 @@ class VoiceConversationSession:
                 self._last_activity = time.time()
             except Exception as e:
                 logging.debug(f"[VoiceConversation] Audio send failed: {e}")
+                return
+            if self._speech_ended_at is not None:
+                self.last_first_audio_latency = time.monotonic() - self._speech_ended_at
+                self._speech_ended_at = None
+                logging.info(
+                    f"[VoiceConversation] End of speech to first audio: "
+                    f"{self.last_first_audio_latency * 1000:.0f}ms"
+                )
 
     # ─── Vision / Image Input ───────────────────────────────────────────
 
@@ -518,172 +567,143 @@ INTENT:"""
     # ─── STT via Voice Server (async httpx) ─────────────────────────────
 
     async def transcribe(self, audio_data: bytes) -> str:
-        """Send audio to voice server for STT transcription."""
+        """Send a complete recording to the voice server for STT transcription."""
         if not self.voice_server:
             logging.error("[VoiceConversation] No VOICE_SERVER configured")
             return ""
 
-        api_url = self.voice_server.rstrip("/") + "/v1/audio/transcriptions"
-        api_key = getenv("EZLOCALAI_API_KEY", "none") or "none"
-
         try:
-            client = self._get_http_client()
-            resp = await client.post(
-                api_url,
-                headers={"Authorization": f"Bearer {api_key}"},
-                files={"file": ("audio.wav", audio_data, "audio/wav")},
-                data={"model": "base"},
-                timeout=30.0,
-            )
-            resp.raise_for_status()
-            result = resp.json()
-            return result.get("text", "").strip()
+            return await self.stt_provider.transcribe(audio_data)
         except Exception as e:
             logging.error(f"[VoiceConversation] STT error: {e}")
             return ""
 
-    # ─── TTS via Voice Server ───────────────────────────────────────────
-
-    async def speak(self, text: str):
-        """Stream TTS audio to client via voice server."""
-        if not text or not self.voice_server or self._cancelled:
+    def start_streaming_input(self, on_transcript, sample_rate: int = STT_SAMPLE_RATE):
+        """
+        Transcribe raw 16-bit mono PCM as it arrives instead of waiting for
+        audio.input.end. on_transcript(text) is awaited with each finished
+        utterance; the endpoint routes it like typed text.
+        """
+        if self._transcriber:
             return
-
-        text = self._clean_for_tts(text)
-        if not text:
+        if not self.voice_server:
+            logging.error("[VoiceConversation] No VOICE_SERVER configured")
             return
+        self._on_transcript = on_transcript
+        self._transcriber = StreamingTranscriber(
+            self.stt_provider,
+            on_partial=self._on_partial_transcript,
+            on_final=self._on_final_transcript,
+            on_speech_start=self._on_speech_start,
+            on_speech_end=self._on_speech_end,
+            sample_rate=sample_rate,
+        )
+        logging.info(
+            f"[VoiceConversation] Streaming input enabled ({sample_rate} Hz PCM)"
+        )
 
-        if self.tts_audio_format == "wav":
-            await self._speak_wav(text)
-            return
+    @property
+    def streaming_input(self) -> bool:
+        return self._transcriber is not None
 
-        await self._speak_pcm_stream(text)
+    async def handle_audio_frame(self, pcm: bytes):
+        """Feed streamed PCM to the endpointer and transcriber."""
+        if self._transcriber:
+            await self._transcriber.feed(pcm)
 
-    def _tts_payload(self, text: str) -> dict:
-        return {
-            "model": "tts-1",
-            "voice": self.tts_voice,
-            "input": text,
-            "language": self.tts_language,
-            "audio_format": self.tts_audio_format,
-        }
+    async def end_audio_input(self):
+        """Client says the user stopped talking; end the utterance now."""
+        if self._transcriber:
+            await self._transcriber.flush()
 
-    async def _speak_wav(self, text: str):
-        api_url = self.voice_server.rstrip("/") + "/v1/audio/speech"
-        api_key = self._voice_api_key()
+    async def _on_speech_start(self):
+        await self._send_event("speech.start", {})
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
+    async def _on_speech_end(self):
+        await self._send_event("speech.end", {})
 
-        try:
-            client = self._get_http_client()
-            response = await client.post(
-                api_url,
-                headers=headers,
-                json=self._tts_payload(text),
-                timeout=120.0,
-            )
-            response.raise_for_status()
-            if self._cancelled:
-                return
+    async def _on_partial_transcript(self, text: str, stable: bool):
+        await self._send_event("transcript.partial", {"text": text, "stable": stable})
+        # Mid-thinker speech becomes steering, which is not triaged the same way
+        if stable and self.state not in (VoiceState.WORKING, VoiceState.NARRATING):
+            if self._speculation.start(text, self._prefetch_turn):
+                logging.debug(f"[VoiceConversation] Prefetching triage: '{text[:60]}'")
+
+    async def _on_final_transcript(self, text: str, speech_ended_at: float):
+        if not text:
+            self._speculation.cancel()
             await self._send_event(
-                "audio.header",
-                {
-                    "format": "wav",
-                    "mime_type": response.headers.get("content-type", "audio/wav"),
-                },
+                "transcript.user",
+                {"text": "", "error": "Could not transcribe audio"},
             )
-            await self._send_audio_chunk(response.content)
-            await self._send_event("audio.end", {})
-        except httpx.HTTPStatusError as e:
-            logging.error(f"[VoiceConversation] TTS WAV HTTP error: {e}")
-        except Exception as e:
-            logging.error(f"[VoiceConversation] TTS WAV error: {e}")
-
-    async def _speak_pcm_stream(self, text: str):
-        api_url = self.voice_server.rstrip("/") + "/v1/audio/speech/stream"
-        api_key = self._voice_api_key()
+            return
+        self._speech_ended_at = speech_ended_at
+        if self._on_transcript:
+            await self._on_transcript(text)
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
+    def _prefetch_turn(self, text: str) -> dict:
+        """Start the speaker's side of a turn; nothing here has side effects."""
+        category = asyncio.ensure_future(self.triage_message(text))
+        return {
+            "category": category,
+            "followup": asyncio.ensure_future(self._prefetch_followup(text, category)),
         }
 
-        try:
-            client = self._get_http_client()
-            async with client.stream(
-                "POST", api_url, headers=headers, json=self._tts_payload(text)
-            ) as response:
-                response.raise_for_status()
-                first_chunk = True
-                async for chunk in self._iter_tts_stream(response):
-                    if self._cancelled:
-                        break
-                    if first_chunk:
-                        await self._send_event(
-                            "audio.header",
-                            {
-                                "format": self.tts_audio_format,
-                                "sample_rate": 24000,
-                                "bits_per_sample": 16,
-                                "channels": 1,
-                            },
-                        )
-                        first_chunk = False
-                    await self._send_audio_chunk(chunk)
+    async def _prefetch_followup(self, text: str, category: asyncio.Future):
+        category = await category
+        if category == "GOODBYE":
+            return await self._generate_goodbye(text)
+        if category == "INSTANT":
+            return await self.generate_instant_answer(text)
+        return await self.generate_speaker_triage(text)
 
-            if not self._cancelled:
-                await self._send_event("audio.end", {})
-        except httpx.HTTPStatusError as e:
-            logging.error(f"[VoiceConversation] TTS stream HTTP error: {e}")
-        except Exception as e:
-            logging.error(f"[VoiceConversation] TTS stream error: {e}")
+    # ─── TTS via Voice Server ───────────────────────────────────────────
 
-    async def _iter_tts_stream(self, response):
-        if self.tts_audio_format == "pcm_framed":
-            async for chunk in response.aiter_bytes(chunk_size=4096):
-                if chunk:
-                    yield chunk
-            return
+    async def speak(self, text: str):
+        """Speak text and wait until its audio has been sent to the client."""
+        await self.tts.wait(self._queue_speech(text))
 
-        buffer = bytearray()
-        framed_stream = None
-        max_frame_size = 2 * 1024 * 1024
+    def _queue_speech(self, text: str) -> Optional[SpeechItem]:
+        """
+        Queue text for TTS without waiting. Queued text plays in order while
+        the sentences behind it are synthesized ahead.
+        """
+        if not text or not self.voice_server or self._cancelled:
+            return None
 
-        async for chunk in response.aiter_bytes(chunk_size=4096):
-            if not chunk:
-                continue
-            if framed_stream is False:
-                yield chunk
-                continue
+        text = self._clean_for_tts(text)
+        if not text:
+            return None
 
-            buffer.extend(chunk)
-            while len(buffer) >= 4:
-                frame_size = struct.unpack("<I", buffer[:4])[0]
-                if frame_size == 0:
-                    del buffer[:4]
-                    continue
-                if frame_size > max_frame_size:
-                    framed_stream = False
-                    if buffer:
-                        yield bytes(buffer)
-                        buffer.clear()
-                    break
-                if len(buffer) < frame_size + 4:
-                    break
-                framed_stream = True
-                yield bytes(buffer[4 : frame_size + 4])
-                del buffer[: frame_size + 4]
+        return self.tts.enqueue(
+            text,
+            voice=self.tts_voice,
+            language=self.tts_language,
+            audio_format=self.tts_audio_format,
+        )
 
-        if buffer:
-            if framed_stream is True:
-                logging.warning(
-                    "[VoiceConversation] Dropping incomplete framed TTS chunk"
-                )
-            else:
-                yield bytes(buffer)
+    async def _play_speech(self, item: SpeechItem, chunks):
+        """Send one queued sentence: header, audio as it is synthesized, end."""
+        first_chunk = True
+        async for chunk in chunks:
+            if self._cancelled:
+                return
+            if first_chunk:
+                if item.audio_format == "wav":
+                    header = {"format": "wav", "mime_type": "audio/wav"}
+                else:
+                    header = {
+                        "format": item.audio_format,
+                        "sample_rate": 24000,
+                        "bits_per_sample": 16,
+                        "channels": 1,
+                    }
+                await self._send_event("audio.header", header)
+                first_chunk = False
+            await self._send_audio_chunk(chunk)
+
+        if not self._cancelled and not item.failed:
+            await self._send_event("audio.end", {})
 
     def _clean_for_tts(self, text: str) -> str:
         """Clean text for TTS - remove code blocks, URLs, XML tags."""
@@ -950,13 +970,23 @@ INTENT:"""
            e. Answer tokens stream to TTS as sentences complete
            f. On thinker failure, retry once; then fall back to speaker error
         """
-        # 1. Triage
-        category = await self.triage_message(user_text)
+        # 1. Triage, already running if a stable partial matched the transcript
+        prefetched = self._speculation.take(user_text)
+        category = None
+        if prefetched:
+            try:
+                category = await prefetched["category"]
+            except (asyncio.CancelledError, Exception):
+                prefetched = {}
+        if category is None:
+            category = await self.triage_message(user_text)
         logging.info(f"[VoiceConversation] Triage: '{user_text[:60]}' -> {category}")
 
         # 2. GOODBYE
         if category == "GOODBYE":
-            goodbye = await self._generate_goodbye(user_text)
+            goodbye = await self._prefetched(
+                prefetched
+            ) or await self._generate_goodbye(user_text)
             await self._send_event(
                 "transcript.agent", {"text": goodbye, "role": "speaker"}
             )
@@ -968,7 +998,9 @@ INTENT:"""
         # 3. INSTANT — 0.8B answers directly
         if category == "INSTANT":
             await self.set_state(VoiceState.ANSWERING)
-            answer = await self.generate_instant_answer(user_text)
+            answer = await self._prefetched(
+                prefetched
+            ) or await self.generate_instant_answer(user_text)
             if answer:
                 logging.info(f'[VoiceConversation] Instant answer: "{answer}"')
                 await self._send_event(
@@ -991,12 +1023,17 @@ INTENT:"""
             self._steering_messages.clear()
 
         # Run triage + thinker start in parallel
-        triage_task = asyncio.ensure_future(self.generate_speaker_triage(user_text))
+        triage_task = prefetched.get("followup") or asyncio.ensure_future(
+            self.generate_speaker_triage(user_text)
+        )
         thinker_task = asyncio.ensure_future(self.run_thinker(user_text))
         self._thinker_task = thinker_task
 
         # Wait for triage (fast, ~200ms)
-        triage = await triage_task
+        try:
+            triage = await triage_task
+        except asyncio.CancelledError:
+            triage = await self.generate_speaker_triage(user_text)
 
         # Inject triage context as [ACTIVITY] for the thinker's continuation loop
         self._log_speaker_triage(triage["intent"], triage["context_note"])
@@ -1007,7 +1044,10 @@ INTENT:"""
         await self._send_event(
             "transcript.agent", {"text": ack_text, "role": "speaker"}
         )
-        ack_speak_task = asyncio.ensure_future(self.speak(ack_text))
+        # Queued now, so it plays before any answer sentence queued after it
+        ack_speak_task = asyncio.ensure_future(
+            self.tts.wait(self._queue_speech(ack_text))
+        )
 
         # 4d/e. Activity-aware narrator + progressive answer TTS
         await self.set_state(VoiceState.WORKING)
@@ -1045,6 +1085,17 @@ INTENT:"""
 
         await self.set_state(VoiceState.IDLE)
 
+    @staticmethod
+    async def _prefetched(prefetched: dict):
+        """Result of the prefetched follow-up, or None to compute it now."""
+        task = prefetched.get("followup")
+        if not task:
+            return None
+        try:
+            return await task
+        except (asyncio.CancelledError, Exception):
+            return None
+
     async def _monitor_thinker(
         self,
         thinker_task: asyncio.Task,
@@ -1122,17 +1173,6 @@ INTENT:"""
                     answer_buffer[answer_spoken_up_to:]
                 )
                 if speakable:
-                    # Ensure ack TTS is done before speaking answer
-                    if ack_speak_task and not ack_speak_task.done():
-                        try:
-                            await asyncio.wait_for(ack_speak_task, timeout=10.0)
-                        except (
-                            asyncio.TimeoutError,
-                            asyncio.CancelledError,
-                        ):
-                            pass
-                        ack_speak_task = None
-
                     if self.state != VoiceState.ANSWERING:
                         await self.set_state(VoiceState.ANSWERING)
                         await self._send_event(
@@ -1140,7 +1180,9 @@ INTENT:"""
                             {"text": "(streaming)", "role": "thinker"},
                         )
 
-                    await self.speak(speakable)
+                    # Queued behind the ack; the next sentence synthesizes
+                    # while this one plays
+                    self._queue_speech(speakable)
                     answer_spoken_up_to += len(speakable)
                 continue
 
@@ -1178,6 +1220,7 @@ INTENT:"""
                 {"text": full_response, "role": "thinker"},
             )
 
+        await self.tts.drain()
         return full_response
 
     async def _generate_informed_narration(self, activity_desc: str) -> str:
@@ -1242,6 +1285,7 @@ INTENT:"""
 
     async def handle_user_audio(self, audio_data: bytes):
         """Main entry point when user sends audio."""
+        self._speech_ended_at = time.monotonic()
         await self.cancel_speaker()
 
         await self.set_state(VoiceState.LISTENING)
@@ -1259,6 +1303,13 @@ INTENT:"""
         logging.info(f"[VoiceConversation] User said: {user_text}")
         await self._process_user_input(user_text)
 
+    async def handle_user_transcript(self, text: str):
+        """Utterance transcribed from streamed audio — same pipeline as audio."""
+        await self.cancel_speaker()
+        await self._send_event("transcript.user", {"text": text})
+        logging.info(f"[VoiceConversation] User said: {text}")
+        await self._process_user_input(text)
+
     async def handle_user_text(self, text: str):
         """Handle text input (typed) — same pipeline but skip STT."""
         await self.cancel_speaker()
@@ -1334,12 +1385,14 @@ INTENT:"""
     async def _speak_in_sentences(self, text: str):
         """Stream TTS sentence-by-sentence for natural delivery."""
         sentences = self._split_sentences(text)
+        last = None
         for sentence in sentences:
             if self._cancelled:
                 break
             sentence = sentence.strip()
             if sentence and len(sentence) > 1:
-                await self.speak(sentence)
+                last = self._queue_speech(sentence) or last
+        await self.tts.wait(last)
 
     def _split_sentences(self, text: str) -> list:
         """Split text into sentences for progressive TTS."""
@@ -1359,13 +1412,9 @@ INTENT:"""
 
     async def cancel_speaker(self):
         """Cancel ongoing speaker audio (barge-in). Thinker keeps running."""
-        if self._speaker_task and not self._speaker_task.done():
-            self._speaker_task.cancel()
-            try:
-                await self._speaker_task
-            except asyncio.CancelledError:
-                pass
-            self._speaker_task = None
+        dropped = self.tts.cancel()
+        if dropped:
+            logging.info(f"[VoiceConversation] Dropped {dropped} queued sentences")
         await self._send_event("audio.interrupt", {})
 
     async def handle_interrupt(self):
@@ -1392,6 +1441,9 @@ INTENT:"""
     async def stop(self):
         """Clean shutdown of the session."""
         self._cancelled = True
+        self._speculation.cancel()
+        if self._transcriber:
+            await self._transcriber.close()
         if self._keepalive_task:
             self._keepalive_task.cancel()
             try:
@@ -1404,12 +1456,8 @@ INTENT:"""
                 await self._thinker_task
             except asyncio.CancelledError:
                 pass
-        if self._speaker_task and not self._speaker_task.done():
-            self._speaker_task.cancel()
-            try:
-                await self._speaker_task
-            except asyncio.CancelledError:
-                pass
+        await self.tts.close()
+        logging.info(f"[VoiceConversation] TTS stats: {self.tts.get_stats()}")
         # Cancel any pending tool result futures
         async with self._tool_result_lock:
             for request_id, future in self._pending_tool_results.items():
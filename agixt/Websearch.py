@@ -119,7 +119,7 @@ class Websearch:
             # We don't want to hit the max tokens limit and risk losing content.
             max_tokens = 8000
         if get_tokens(text=content) < int(max_tokens):
-            return self.ApiClient.prompt_agent(
+            return await self.ApiClient.prompt_agent_async(
                 agent_id=self.agent.agent_id,
                 prompt_name="Web Summary",
                 prompt_args={
@@ -140,7 +140,7 @@ class Websearch:
         new_content = []
         for chunk in chunks:
             new_content.append(
-                self.ApiClient.prompt_agent(
+                await self.ApiClient.prompt_agent_async(
                     agent_id=self.agent.agent_id,
                     prompt_name="Web Summary",
                     prompt_args={
@@ -287,7 +287,7 @@ class Websearch:
                                 message=f"[SUBACTIVITY][{activity_id}] Found {len(link_list)} links on [{url}]({url}) . Choosing one to browse next.",
                             )
                         try:
-                            pick_a_link = self.ApiClient.prompt_agent(
+                            pick_a_link = await self.ApiClient.prompt_agent_async(
                                 agent_id=self.agent.agent_id,
                                 prompt_name="Pick-a-Link",
                                 prompt_args={
@@ -1,20 +1,59 @@
+"""
+WorkerRegistry - Active conversations and stop requests across workers
+
+Each uvicorn worker registers the conversations it is running here. The
+asyncio task of a conversation only exists in the worker that started it,
+but a stop request or the "active conversations" list can land on any
+worker. With a shared cache (Redis behind SharedCache) the registry also:
+
+- publishes every running conversation with a heartbeat, per conversation
+  and in per-user and cluster-wide hashes, so listings see all workers and
+  entries of a worker that died age out after CONVERSATION_HEARTBEAT_TTL;
+- sends stops for conversations owned elsewhere over pub/sub. The owner's
+  listener thread marks the conversation stopped and cancels its task. A
+  stop key catches owners that missed the message at their next heartbeat;
+- prunes stale entries from one worker at a time, under a short lease.
+
+`is_stopped` stays an in-memory set lookup on the owning worker, cheap
+enough for run_stream to call while streaming tokens. Without Redis the
+registry is the single-process implementation it always was.
+"""
+
 import asyncio
 import logging
+import os
+import socket
 import time
-from typing import Callable, Dict, List, Set, Optional
+from typing import Any, Callable, Dict, List, Set, Optional
 from datetime import datetime
 import threading
 
+from SharedCache import shared_cache
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds a conversation stays listed after its worker's last heartbeat
+CONVERSATION_HEARTBEAT_TTL = int(os.getenv("CONVERSATION_HEARTBEAT_TTL", "30"))
+
+# How long stop_conversation waits for the conversation to wind down
+CONVERSATION_STOP_TIMEOUT = 2.0
+
+CONVERSATION_EVENTS_CHANNEL = "conversation_events"
+ACTIVE_CONVERSATIONS_KEY = "conversations_active"
+
 
 class WorkerRegistry:
     """
     Registry to track active conversation workers and allow cancellation
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        cache=None,
+        worker_id: str = None,
+        heartbeat_ttl: int = CONVERSATION_HEARTBEAT_TTL,
+    ):
         self._active_conversations: Dict[str, Dict] = (
             {}
         )  # conversation_id -> worker_info
@@ -29,6 +68,18 @@ class WorkerRegistry:
         # push live state changes to the frontend so it can stop polling
         # /v1/conversations/active every 15 seconds.
         self._state_listeners: List[Callable[[str, Dict], None]] = []
+        # Shared state for the other workers; None keeps everything in-process
+        self.cache = cache
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_ttl = heartbeat_ttl
+        self._listener: Optional[threading.Thread] = None
+        self._running = False
+        self.stats = {
+            "stops_sent": 0,
+            "stops_received": 0,
+            "heartbeats": 0,
+            "pruned": 0,
+        }
 
     def add_state_listener(self, listener: Callable[[str, Dict], None]) -> None:
         """Register a listener for working/idle transitions.
@@ -82,6 +133,10 @@ class WorkerRegistry:
             if task:
                 self._conversation_tasks[conversation_id] = task
 
+        if self.cache is not None:
+            self._share(worker_info)
+            self._ensure_listener()
+
         # Emit AFTER releasing the lock so listener callbacks can do whatever
         # they need (including reading registry state) without deadlocking.
         self._emit_state(
@@ -123,6 +178,8 @@ class WorkerRegistry:
 
             self._stopped_conversations.discard(conversation_id)
 
+        if removed and self.cache is not None:
+            self._unshare(conversation_id, info_snapshot["user_id"])
         if removed and info_snapshot is not None:
             self._emit_state("ended", info_snapshot)
         return removed
@@ -143,7 +200,10 @@ class WorkerRegistry:
             Dict or None: Conversation info if found
         """
         with self._lock:
-            return self._active_conversations.get(conversation_id)
+            info = self._active_conversations.get(conversation_id)
+        if info is None:
+            return self._shared_info(conversation_id)
+        return info
 
     def get_user_conversations(self, user_id: str) -> Dict[str, Dict]:
         """
@@ -160,7 +220,10 @@ class WorkerRegistry:
             for conv_id, info in self._active_conversations.items():
                 if info["user_id"] == user_id:
                     user_conversations[conv_id] = info.copy()
-            return user_conversations
+        # Conversations running on other workers
+        for conv_id, info in self._shared_fields(self._user_key(user_id)).items():
+            user_conversations.setdefault(conv_id, info)
+        return user_conversations
 
     def get_all_active_conversations(self) -> Dict[str, Dict]:
         """
@@ -170,7 +233,10 @@ class WorkerRegistry:
             Dict: Dictionary of all active conversations
         """
         with self._lock:
-            return self._active_conversations.copy()
+            conversations = self._active_conversations.copy()
+        for conv_id, info in self._shared_fields(ACTIVE_CONVERSATIONS_KEY).items():
+            conversations.setdefault(conv_id, info)
+        return conversations
 
     async def stop_conversation(
         self, conversation_id: str, user_id: str = None
@@ -188,19 +254,18 @@ class WorkerRegistry:
         with self._lock:
             conversation_info = self._active_conversations.get(conversation_id)
 
-            if not conversation_info:
-                logger.warning(
-                    f"Conversation {conversation_id} not found in active registry"
-                )
-                return False
+        if not conversation_info:
+            # Running on another worker, if anywhere
+            return await self._stop_remote(conversation_id, user_id)
 
-            # Validate user ownership if user_id provided
-            if user_id and conversation_info["user_id"] != user_id:
-                logger.warning(
-                    f"User {user_id} attempted to stop conversation {conversation_id} owned by {conversation_info['user_id']}"
-                )
-                return False
+        # Validate user ownership if user_id provided
+        if user_id and conversation_info["user_id"] != user_id:
+            logger.warning(
+                f"User {user_id} attempted to stop conversation {conversation_id} owned by {conversation_info['user_id']}"
+            )
+            return False
 
+        with self._lock:
             # Mark as explicitly stopped so the stream handler knows not to
             # continue processing in the background.
             self._stopped_conversations.add(conversation_id)
@@ -275,6 +340,14 @@ class WorkerRegistry:
             if self.unregister_conversation(conversation_id):
                 cleaned_up += 1
 
+        # Entries left behind by workers that died, pruned by one worker
+        if self.cache is not None and self.cache.set_if_not_exists(
+            "conversations_prune_lease",
+            self.worker_id,
+            ttl=max(1, self.heartbeat_ttl // 3),
+        ):
+            cleaned_up += self._prune_stale()
+
         if cleaned_up > 0:
             logger.info(f"Cleaned up {cleaned_up} finished conversations")
 
@@ -287,9 +360,232 @@ class WorkerRegistry:
         Returns:
             int: Number of active conversations
         """
+        if self.cache is None:
+            with self._lock:
+                return len(self._active_conversations)
+        return len(self.get_all_active_conversations())
+
+    # Shared state
+
+    def _info_key(self, conversation_id: str) -> str:
+        return f"conversation_active:{conversation_id}"
+
+    def _user_key(self, user_id: str) -> str:
+        return f"conversations_user:{user_id}"
+
+    def _stop_key(self, conversation_id: str) -> str:
+        return f"conversation_stop:{conversation_id}"
+
+    def _share(self, worker_info: Dict):
+        started_at = worker_info["started_at"]
+        info = {
+            "conversation_id": worker_info["conversation_id"],
+            "user_id": worker_info["user_id"],
+            "agent_name": worker_info["agent_name"],
+            "started_at": (
+                started_at.isoformat()
+                if isinstance(started_at, datetime)
+                else started_at
+            ),
+            "worker_id": self.worker_id,
+            "heartbeat_at": time.time(),
+        }
+        conversation_id = info["conversation_id"]
+        try:
+            self.cache.set(
+                self._info_key(conversation_id), info, ttl=self.heartbeat_ttl
+            )
+            self.cache.set_field(
+                self._user_key(info["user_id"]),
+                conversation_id,
+                info,
+                ttl=self.heartbeat_ttl,
+            )
+            self.cache.set_field(
+                ACTIVE_CONVERSATIONS_KEY, conversation_id, info, ttl=self.heartbeat_ttl
+            )
+        except Exception as e:
+            logger.warning(f"Failed to share conversation {conversation_id}: {e}")
+
+    def _unshare(self, conversation_id: str, user_id: str):
+        try:
+            info = self.cache.get(self._info_key(conversation_id))
+            # The same conversation may have been started again elsewhere
+            if info and info.get("worker_id") != self.worker_id:
+                return
+            self.cache.delete(self._info_key(conversation_id))
+            self.cache.delete_field(self._user_key(user_id), conversation_id)
+            self.cache.delete_field(ACTIVE_CONVERSATIONS_KEY, conversation_id)
+            self.cache.delete(self._stop_key(conversation_id))
+        except Exception as e:
+            logger.warning(f"Failed to unshare conversation {conversation_id}: {e}")
+
+    def _fresh(self, info: Any) -> bool:
+        return (
+            isinstance(info, dict)
+            and time.time() - info.get("heartbeat_at", 0) <= self.heartbeat_ttl
+        )
+
+    def _shared_info(self, conversation_id: str) -> Optional[Dict]:
+        if self.cache is None:
+            return None
+        try:
+            info = self.cache.get(self._info_key(conversation_id))
+        except Exception as e:
+            logger.debug(f"Shared conversation lookup failed: {e}")
+            return None
+        return info if self._fresh(info) else None
+
+    def _shared_fields(self, key: str) -> Dict[str, Dict]:
+        if self.cache is None:
+            return {}
+        try:
+            fields = self.cache.get_fields(key)
+        except Exception as e:
+            logger.debug(f"Shared conversation listing failed: {e}")
+            return {}
+        return {conv_id: info for conv_id, info in fields.items() if self._fresh(info)}
+
+    def _prune_stale(self) -> int:
+        pruned = 0
+        for conv_id, info in self.cache.get_fields(ACTIVE_CONVERSATIONS_KEY).items():
+            if self._fresh(info):
+                continue
+            self.cache.delete_field(ACTIVE_CONVERSATIONS_KEY, conv_id)
+            if isinstance(info, dict) and info.get("user_id"):
+                self.cache.delete_field(self._user_key(info["user_id"]), conv_id)
+            pruned += 1
+        if pruned:
+            self.stats["pruned"] += pruned
+            logger.info(f"Pruned {pruned} conversations of workers that stopped")
+        return pruned
+
+    async def _stop_remote(self, conversation_id: str, user_id: str = None) -> bool:
+        """Ask the worker running a conversation to stop it."""
+        info = self._shared_info(conversation_id)
+        if not info:
+            logger.warning(
+                f"Conversation {conversation_id} not found in active registry"
+            )
+            return False
+        if user_id and info["user_id"] != user_id:
+            logger.warning(
+                f"User {user_id} attempted to stop conversation {conversation_id} owned by {info['user_id']}"
+            )
+            return False
+        owner = info["worker_id"]
+        self.cache.set(self._stop_key(conversation_id), owner, ttl=self.heartbeat_ttl)
+        self.cache.publish(
+            CONVERSATION_EVENTS_CHANNEL,
+            {"action": "stop", "conversation_id": conversation_id, "worker_id": owner},
+        )
+        self.stats["stops_sent"] += 1
+
+        # Wait for the owner to wind it down, as a local stop does. The stop
+        # key stays set, so an owner that missed the message still stops at
+        # its next heartbeat even if that is after the timeout
+        deadline = time.monotonic() + CONVERSATION_STOP_TIMEOUT
+        while await asyncio.to_thread(
+            self.cache.exists, self._info_key(conversation_id)
+        ):
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    f"Conversation {conversation_id} on worker {owner} did not stop within {CONVERSATION_STOP_TIMEOUT}s"
+                )
+                return False
+            await asyncio.sleep(0.02)
+        logger.info(f"Stopped conversation {conversation_id} on worker {owner}")
+        return True
+
+    def _signal_stop(self, conversation_id: str) -> bool:
+        """Stop a local conversation from any thread."""
+        with self._lock:
+            if conversation_id not in self._active_conversations:
+                return False
+            self._stopped_conversations.add(conversation_id)
+            task = self._conversation_tasks.get(conversation_id)
+        self.stats["stops_received"] += 1
+        if task and not task.done():
+            # The conversation's unregister in its finally block cleans up
+            task.get_loop().call_soon_threadsafe(task.cancel)
+        logger.info(f"Conversation {conversation_id} stopped from another worker")
+        return True
+
+    def _handle_event(self, event: Optional[Dict]):
+        if not isinstance(event, dict) or event.get("action") != "stop":
+            return
+        if event.get("worker_id") == self.worker_id:
+            self._signal_stop(event.get("conversation_id"))
+
+    def heartbeat(self):
+        """Renew this worker's conversations and pick up stops it missed."""
+        with self._lock:
+            conversations = list(self._active_conversations.values())
+            stopped = set(self._stopped_conversations)
+        for info in conversations:
+            conversation_id = info["conversation_id"]
+            self._share(info)
+            if conversation_id not in stopped and self.cache.get(
+                self._stop_key(conversation_id)
+            ):
+                self._signal_stop(conversation_id)
+        self.stats["heartbeats"] += 1
+        self.cleanup_finished_conversations()
+
+    def _ensure_listener(self):
+        if self._listener is not None:
+            return
         with self._lock:
-            return len(self._active_conversations)
+            if self._listener is not None:
+                return
+            self._running = True
+            self._listener = threading.Thread(
+                target=self._listen, name="conversation-registry", daemon=True
+            )
+        self._listener.start()
+
+    def _listen(self):
+        subscription = self.cache.subscribe(CONVERSATION_EVENTS_CHANNEL)
+        interval = max(1, self.heartbeat_ttl // 3)
+        next_heartbeat = time.monotonic() + interval
+        try:
+            while self._running:
+                try:
+                    self._handle_event(subscription.get_message(timeout=0.5))
+                    if time.monotonic() >= next_heartbeat:
+                        next_heartbeat = time.monotonic() + interval
+                        self.heartbeat()
+                except Exception as e:
+                    logger.error(f"Conversation registry listener failed: {e}")
+                    time.sleep(1)
+        finally:
+            subscription.close()
+
+    def close(self):
+        """Stop the listener thread."""
+        self._running = False
+        listener, self._listener = self._listener, None
+        if listener is not None and listener is not threading.current_thread():
+            listener.join(timeout=2)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            local = len(self._active_conversations)
+        return {
+            **self.stats,
+            "worker_id": self.worker_id,
+            "shared": self.cache is not None,
+            "local_conversations": local,
+        }
+
+
+def _registry_cache():
+    # Without Redis, other workers could not see what is shared
+    try:
+        return shared_cache if shared_cache.is_redis_available else None
+    except Exception:
+        return None
 
 
 # Global worker registry instance
-worker_registry = WorkerRegistry()
+worker_registry = WorkerRegistry(cache=_registry_cache())
@@ -14,7 +14,9 @@ from Models import ChatCompletions, TasksToDo, ChainCommandName, TranslationRequ
 from middleware import log_silenced_exception
 from datetime import datetime
 from typing import (
+    Callable,
     List,
+    Optional,
     Type,
     Union,
     get_args,
@@ -23,15 +25,21 @@ from typing import (
 )
 from MagicalAuth import MagicalAuth
 from WorkerRegistry import worker_registry
+from BatchInference import run_batch
+from DocumentIngestion import (
+    extract_document,
+    extract_zip,
+    get_extractor,
+    throttle_progress,
+)
+from InternalInvocation import invocation_scope
 from enum import Enum
 from pydantic import BaseModel
-from pptx import Presentation
 from urllib.parse import urlparse, urljoin
 from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import ipaddress
 import socket
 import pdfplumber
-import docx2txt
 import zipfile
 import pandas as pd
 import subprocess
@@ -1157,7 +1165,7 @@ Rules:
                     step_agent_id = get_agent_id_by_name(
                         agent_name=agent_name, user=self.user_email
                     )
-                    result = self.ApiClient.prompt_agent(
+                    result = await self.ApiClient.prompt_agent_async(
                         agent_id=step_agent_id,
                         prompt_name=prompt_name,
                         prompt_args=prompt_args,
@@ -1633,6 +1641,7 @@ Rules:
         collection_id: str = "0",
         thinking_id: str = "",
         save_to_memory: bool = False,
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
     ):
         """
         Learn from a file
@@ -1645,6 +1654,8 @@ Rules:
             thinking_id (str): Thinking ID for activity logging
             save_to_memory (bool): Whether to save file content to agent memories for RAG.
                                    Set to True for learn endpoints, False for chat completions.
+            on_progress (Callable): Called with (stage, done, total) while the file is
+                                    extracted and memorized, possibly from a worker thread.
 
         Returns:
             str: Response from the agent
@@ -1699,55 +1710,38 @@ Rules:
                 role=self.agent_name,
                 message=f"[SUBACTIVITY][{thinking_id}] {action_verb} [{file_name}]({file_url}) {action_location}.",
             )
-        if file_type in ["ppt", "pptx"]:
-            # Extract text directly from PowerPoint using python-pptx
-            self.conversation.log_interaction(
-                role=self.agent_name,
-                message=f"[SUBACTIVITY][{thinking_id}] {action_verb} PowerPoint file [{file_name}]({file_url}) {action_location}.",
-            )
-            try:
-                prs = Presentation(file_path)
-                pptx_content = []
-                for slide_num, slide in enumerate(prs.slides, 1):
-                    slide_text = []
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text") and shape.text.strip():
-                            slide_text.append(shape.text.strip())
-                    if slide_text:
-                        pptx_content.append(
-                            f"Slide {slide_num}:\n" + "\n".join(slide_text)
-                        )
-                content = "\n\n".join(pptx_content)
-                pptx_content_str = (
-                    f"Content from PowerPoint uploaded named `{file_name}`:\n{content}"
-                )
-                file_content += pptx_content_str
-                self.input_tokens += get_tokens(content)
-                if save_to_memory:
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    await self.file_reader.write_text_to_memory(
-                        user_input=user_input,
-                        text=f"Content from PowerPoint uploaded at {timestamp} named `{file_name}`:\n{content}",
-                        external_source=f"file {file_path}",
-                    )
-                response = f"{'Learned' if save_to_memory else 'Saved'} [{file_name}]({file_url}) {'to memory' if save_to_memory else 'to workspace'}."
-            except Exception as e:
-                logging.error(f"Error reading PowerPoint file: {e}")
-                return f"Failed to read PowerPoint file [{file_name}]({file_url}). Error: {str(e)}"
         if user_input == "":
             user_input = "Describe each stage of this image."
         disallowed_types = ["exe", "bin", "rar"]
-        if file_type in ["ppt", "pptx"]:
-            # Already handled above, response is set
-            pass
-        elif file_type in disallowed_types:
+        if file_type in disallowed_types:
             response = f"[ERROR] I was unable to read the file called `{file_name}`."
-        elif file_type == "pdf":
-            file_content += f"Content from PDF uploaded named `{file_name}`:\n"
-            with pdfplumber.open(file_path) as pdf:
-                content = "\n".join([page.extract_text() for page in pdf.pages])
-                file_content += content
-            if "pdf_vision" in self.agent_settings:
+        elif get_extractor(file_name) is not None:
+            # PDF, Word and PowerPoint text is extracted off the event loop,
+            # PDF pages in parallel worker processes
+            def log_extraction(done, total):
+                if 0 < done < total:
+                    self.conversation.log_interaction(
+                        role=self.agent_name,
+                        message=f"[SUBACTIVITY][{thinking_id}] Reading [{file_name}]({file_url}): {done * 100 // total}% done.",
+                    )
+
+            activity = throttle_progress(log_extraction)
+
+            def extraction_progress(done, total):
+                if on_progress:
+                    on_progress("extracting", done, total)
+                activity(done, total)
+
+            try:
+                document = await extract_document(
+                    file_path, progress=extraction_progress
+                )
+            except Exception as e:
+                logging.error(f"Error reading {file_name}: {e}")
+                return f"Failed to read [{file_name}]({file_url}). Error: {str(e)}"
+            content = document.text
+            file_content += f"Content from {document.label} uploaded named `{file_name}`:\n{content}"
+            if file_type == "pdf" and "pdf_vision" in self.agent_settings:
                 if (
                     self.agent_settings["pdf_vision"] != "None"
                     and self.agent_settings["pdf_vision"] != ""
@@ -1778,10 +1772,12 @@ Rules:
                         file_content += vision_response
             self.input_tokens += get_tokens(content)
             if save_to_memory:
+                if on_progress:
+                    on_progress("memorizing", 0, 1)
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 await self.file_reader.write_text_to_memory(
                     user_input=user_input,
-                    text=f"Content from PDF uploaded at {timestamp} named `{file_name}`:\n{content}",
+                    text=f"Content from {document.label} uploaded at {timestamp} named `{file_name}`:\n{content}",
                     external_source=f"file {file_path}",
                 )
             response = f"{'Learned' if save_to_memory else 'Saved'} [{file_name}]({file_url}) {'to memory' if save_to_memory else 'to workspace'}."
@@ -1793,9 +1789,23 @@ Rules:
                 )
             )
             file_content += f"Content from the zip file uploaded named `{file_name}`:\n"
+            extraction = None
+            response = f"[ERROR] I was unable to read the file called `{file_name}`."
             if new_folder.startswith(self.agent_workspace):
-                with zipfile.ZipFile(file_path, "r") as zipObj:
-                    zipObj.extractall(path=new_folder)
+
+                def zip_progress(done, total):
+                    if on_progress:
+                        on_progress("extracting", done, total)
+
+                # Members are streamed out one at a time within size limits
+                try:
+                    extraction = await asyncio.to_thread(
+                        extract_zip, file_path, new_folder, None, zip_progress
+                    )
+                except (ValueError, zipfile.BadZipFile) as e:
+                    logging.warning(f"Rejected zip file {file_name}: {e}")
+                    response = f"[ERROR] I was unable to extract the zip file called `{file_name}`. {e}"
+            if extraction is not None:
                 # Build folder structure summary instead of processing each file
                 # This prevents spamming activities for large repos like Flipper-IRDB
                 folder_structure = []
@@ -1837,26 +1847,10 @@ Rules:
                     f"Extracted folder path: `{extracted_zip_folder_name}/`\n\n"
                 )
                 file_content += f"Folder structure:\n{structure_summary}\n"
+                if extraction.skipped:
+                    file_content += f"\nSkipped {len(extraction.skipped)} unsafe entries (absolute paths, `..` or links).\n"
                 file_content += f"\n**IMPORTANT**: To read files, use paths like `{extracted_zip_folder_name}/subfolder/file.ext` - do NOT try to read the .zip file directly."
                 response = f"Extracted zip file [{file_name}]({file_url}) to `{extracted_zip_folder_name}/` ({file_count} files in {dir_count} directories). Use the EXTRACTED FOLDER to browse files, not the zip."
-            else:
-                response = (
-                    f"[ERROR] I was unable to read the file called `{file_name}`."
-                )
-        elif file_path.endswith(".doc") or file_path.endswith(".docx"):
-            content = docx2txt.process(file_path)
-            docx_content = (
-                f"Content from the document uploaded named `{file_name}`:\n{content}"
-            )
-            file_content += docx_content
-            self.input_tokens += get_tokens(content)
-            if save_to_memory:
-                await self.file_reader.write_text_to_memory(
-                    user_input=user_input,
-                    text=docx_content,
-                    external_source=f"file {file_path}",
-                )
-            response = f"{'Learned' if save_to_memory else 'Saved'} [{file_name}]({file_url}) {'to memory' if save_to_memory else 'to workspace'}."
         elif file_type == "xlsx" or file_type == "xls" or file_type == "csv":
             response, content = await self.learn_spreadsheet(
                 user_input=user_input,
@@ -2493,7 +2487,11 @@ Rules:
         )
 
         try:
-            return await self._execute_chat_completions(prompt)
+            # Nested agent calls made during this completion stop with it
+            with invocation_scope(
+                cancel_check=lambda: worker_registry.is_stopped(conversation_id)
+            ):
+                return await self._execute_chat_completions(prompt)
         except asyncio.CancelledError:
             logging.info(
                 f"Chat completion cancelled for conversation {conversation_id}"
@@ -5068,6 +5066,37 @@ Rules:
         yield f"data: {json.dumps(final_chunk)}\n\n"
         yield "data: [DONE]\n\n"
 
+    def get_batch_workers(
+        self,
+        raw_prompts: bool = False,
+        provider_batching: bool = False,
+        images: list = [],
+        **inference_kwargs,
+    ):
+        """
+        Build the per-item worker (and optional provider batch worker) for run_batch
+
+        With raw_prompts, inputs go straight to the agent's provider; otherwise
+        each input is a user input run through `inference` with the given kwargs.
+        Provider batching only applies to raw text prompts.
+        """
+        if raw_prompts:
+
+            async def worker(prompt):
+                return await self.agent.inference(prompt=prompt, images=images)
+
+        else:
+
+            async def worker(user_input):
+                return await self.inference(
+                    user_input=user_input, images=images, **inference_kwargs
+                )
+
+        batch_worker = None
+        if raw_prompts and provider_batching and not images:
+            batch_worker = self.agent.batch_inference
+        return worker, batch_worker
+
     async def batch_inference(
         self,
         user_inputs: List[str] = [],
@@ -5079,34 +5108,64 @@ Rules:
         browse_links: bool = False,
         voice_response: bool = False,
         log_user_input: bool = False,
+        timeout: float = None,
+        retries: int = 0,
+        raw_prompts: bool = False,
+        provider_batching: bool = False,
+        return_results: bool = False,
         **kwargs,
     ):
-        i = 0
-        tasks = []
-        responses = []
+        """
+        Run many inputs through the agent concurrently
+
+        Args:
+            user_inputs (List[str]): Inputs to run, one inference each
+            prompt_category (str): Category of the prompt
+            prompt_name (str): Name of the prompt to use
+            batch_size (int): Maximum inferences in flight at once
+            timeout (float): Per-attempt timeout in seconds
+            retries (int): Extra attempts for items that fail or time out
+            raw_prompts (bool): Send inputs straight to the provider without
+                prompt templates, memories or logging
+            provider_batching (bool): With raw_prompts, group inputs into the
+                provider's native batch API when it has one
+            return_results (bool): Return BatchItemResult objects carrying
+                per-item errors instead of plain strings
+
+        Returns:
+            list: Responses in input order ("" for failed items unless
+            return_results is set)
+        """
         if user_inputs == []:
             return []
-        for user_input in user_inputs:
-            i += 1
-            if i % batch_size == 0:
-                responses += await asyncio.gather(**tasks)
-                tasks = []
-            task = asyncio.create_task(
-                await self.inference(
-                    user_input=user_input,
-                    prompt_category=prompt_category,
-                    prompt_name=prompt_name,
-                    images=images,
-                    injected_memories=injected_memories,
-                    browse_links=browse_links,
-                    voice_response=voice_response,
-                    log_user_input=log_user_input,
-                    **kwargs,
+        worker, batch_worker = self.get_batch_workers(
+            raw_prompts=raw_prompts,
+            provider_batching=provider_batching,
+            prompt_category=prompt_category,
+            prompt_name=prompt_name,
+            images=images,
+            injected_memories=injected_memories,
+            browse_links=browse_links,
+            voice_response=voice_response,
+            log_user_input=log_user_input,
+            **kwargs,
+        )
+        results = await run_batch(
+            user_inputs,
+            worker,
+            concurrency=batch_size,
+            timeout=timeout,
+            retries=retries,
+            batch_worker=batch_worker,
+        )
+        if return_results:
+            return results
+        for result in results:
+            if not result.ok:
+                logging.warning(
+                    f"Batch inference item {result.index} failed: {result.error}"
                 )
-            )
-            tasks.append(task)
-        responses += await asyncio.gather(**tasks)
-        return responses
+        return [result.output if result.ok else "" for result in results]
 
     async def dpo(
         self,
@@ -5155,7 +5214,7 @@ Rules:
             )
         memories = [memory["text"] for memory in memories]
         # Get a list of questions about each memory
-        question_list = self.batch_inference(
+        question_list = await self.batch_inference(
             user_inputs=memories,
             batch_size=batch_size,
             prompt_category="Default",
@@ -42,6 +42,15 @@ from contextlib import asynccontextmanager
 from Workspaces import WorkspaceManager
 from typing import Optional
 from TaskMonitor import TaskMonitor
+from MemoryCompaction import memory_compaction
+from MemoryLifecycle import memory_lifecycle
+from BillingAnalytics import usage_rollups
+from Entitlements import entitlements
+from DocumentIngestion import shutdown_process_pool
+from EmbeddingService import embedding_batcher, local_embedder
+from CredentialService import credential_service
+from ContextPacker import context_packer
+from mcp_client import mcp_sessions
 from ExtensionsHub import ExtensionsHub
 
 
@@ -163,6 +172,18 @@ async def lifespan(app: FastAPI):
 
         workspace_manager.start_file_watcher()
         await task_monitor.start()
+        if getenv("MEMORY_COMPACTION_ENABLED", "false").lower() == "true":
+            await memory_compaction.start()
+        if getenv("MEMORY_LIFECYCLE_ENABLED", "true").lower() != "true":
+            # Retrieval stats are still flushed; only enforcement is off
+            memory_lifecycle.interval = 0
+        await memory_lifecycle.start()
+        if getenv("USAGE_ROLLUP_ENABLED", "true").lower() == "true":
+            await usage_rollups.start()
+        await entitlements.start()
+        if getenv("EMBEDDING_WARMUP", "true").lower() == "true":
+            # Load the embedding model now instead of on the first request
+            asyncio.get_running_loop().run_in_executor(None, local_embedder.warmup)
         yield
     except Exception as e:
         logging.error(f"Error during startup: {e}")
@@ -173,6 +194,15 @@ async def lifespan(app: FastAPI):
             logging.info("Shutting down AGiXT services...")
             workspace_manager.stop_file_watcher()
             await task_monitor.stop()
+            await memory_compaction.stop()
+            await memory_lifecycle.stop()
+            await usage_rollups.stop()
+            await entitlements.stop()
+            # Stdio MCP servers are child processes; don't leave them running
+            await mcp_sessions.close_all()
+            shutdown_process_pool()
+            embedding_batcher.shutdown()
+            credential_service.shutdown()
             logging.info("AGiXT services stopped successfully")
         except Exception as e:
             logging.error(f"Error during shutdown: {e}")
@@ -184,6 +214,11 @@ async def cleanup():
         logging.info("Performing emergency cleanup...")
         workspace_manager.stop_file_watcher()
         await task_monitor.stop()
+        await memory_compaction.stop()
+        await memory_lifecycle.stop()
+        await usage_rollups.stop()
+        await entitlements.stop()
+        await mcp_sessions.close_all()
         logging.info("Emergency cleanup completed")
     except Exception as e:
         logging.error(f"Error during emergency cleanup: {e}")
@@ -345,6 +380,17 @@ async def get_cache_stats(authorization: str = Header(None)):
         raise HTTPException(status_code=500, detail=f"Error getting cache stats")
 
 
+# Context packing stats: how often prompts needed trimming or LLM reduction
+@app.get("/v1/context/stats", tags=["Health"])
+async def get_context_stats(authorization: str = Header(None)):
+    """
+    Get prompt context packing statistics for this worker: turns packed,
+    turns that needed trimming, how many fell back to LLM-based reduction,
+    and average packing time.
+    """
+    return context_packer.get_stats()
+
+
 @app.delete("/v1/cache", tags=["Health"])
 async def clear_cache(
     user_id: str = None,
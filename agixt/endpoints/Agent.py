@@ -44,7 +44,10 @@ from Models import (
     ChatCompletions,
     ThinkingPrompt,
     WalletResponseModel,
+    BatchInferenceRequest,
+    BatchJobResponse,
 )
+from BatchInference import batch_jobs
 import logging
 import base64
 import uuid
@@ -680,6 +683,103 @@ async def prompt_agent_v1(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post(
+    "/v1/agent/{agent_id}/batch",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key)],
+    summary="Submit a batch inference job",
+    description="Runs many inputs through an agent concurrently in the background. Returns a job that can be polled with GET /v1/batch/{job_id}. Each item has its own timeout and retries, and results keep input order with per-item errors. With raw_prompts, inputs are sent straight to the provider, optionally using its native batch API.",
+    response_model=BatchJobResponse,
+)
+async def submit_batch_inference(
+    agent_id: str,
+    batch: BatchInferenceRequest,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+):
+    try:
+        ApiClient = get_api_client(authorization=authorization)
+        agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
+        prompt_args = dict(batch.prompt_args)
+        conversation_name = prompt_args.pop("conversation_name", None)
+        prompt_args.pop("user_input", None)
+        prompt_args.setdefault("log_user_input", False)
+        prompt_args.setdefault("log_output", False)
+        agixt_agent = AGiXT(
+            user=user,
+            agent_name=agent.agent_name,
+            api_key=authorization,
+            conversation_name=conversation_name,
+        )
+        worker, batch_worker = agixt_agent.get_batch_workers(
+            raw_prompts=batch.raw_prompts,
+            provider_batching=batch.provider_batching,
+            prompt_category=batch.prompt_category,
+            prompt_name=batch.prompt_name,
+            **prompt_args,
+        )
+        return batch_jobs.submit(
+            user_id=get_user_id(user=user),
+            inputs=batch.user_inputs,
+            worker=worker,
+            metadata={
+                "agent_id": agent_id,
+                "prompt_name": None if batch.raw_prompts else batch.prompt_name,
+            },
+            concurrency=batch.concurrency,
+            timeout=batch.timeout,
+            retries=batch.retries,
+            batch_worker=batch_worker,
+            provider_batch_size=batch.provider_batch_size,
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error submitting batch inference: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get(
+    "/v1/batch/{job_id}",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key)],
+    summary="Get a batch inference job",
+    description="Returns the status and progress of a batch inference job, plus its ordered results once it has finished.",
+    response_model=BatchJobResponse,
+)
+async def get_batch_inference_job(
+    job_id: str,
+    include_results: bool = True,
+    user=Depends(verify_api_key),
+):
+    job = batch_jobs.get(
+        job_id=job_id,
+        user_id=get_user_id(user=user),
+        include_results=include_results,
+    )
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
+@app.delete(
+    "/v1/batch/{job_id}",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key)],
+    summary="Cancel a batch inference job",
+    description="Stops a queued or running batch job. Items that already finished keep their results, and the rest are marked cancelled.",
+    response_model=ResponseMessage,
+)
+async def cancel_batch_inference_job(job_id: str, user=Depends(verify_api_key)):
+    if not batch_jobs.cancel(job_id=job_id, user_id=get_user_id(user=user)):
+        raise HTTPException(
+            status_code=404, detail="Batch job not found or already finished"
+        )
+    return ResponseMessage(message="Batch job cancellation requested")
+
+
 @app.get(
     "/v1/agent/{agent_id}/command",
     tags=["Agent"],
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import json
@@ -35,6 +36,7 @@ from MagicalAuth import (
     get_oauth_providers,
 )
 from middleware import send_discord_new_user_notification
+from CredentialService import credential_service
 from Agent import Agent
 from typing import List
 from Globals import getenv
@@ -158,7 +160,10 @@ async def register(register: Register):
                     detail="An inactive account exists with this email. Please contact your administrator.",
                 )
 
-    result = auth.register(
+    # Hashing the password blocks until the hashing pool is done; keep it
+    # off the event loop
+    result = await asyncio.to_thread(
+        auth.register,
         new_user=register,
         invitation_id=register.invitation_id if register.invitation_id else None,
     )
@@ -500,7 +505,10 @@ async def login(request: Request, login: Login):
     auth = MagicalAuth()
     client_ip = request.headers.get("X-Forwarded-For") or request.client.host
 
-    result = auth.login_with_password(
+    # Throttled or overloaded logins get 429 before any database or hashing work
+    credential_service.check_login(client_ip, login.username)
+    result = await asyncio.to_thread(
+        auth.login_with_password,
         username=login.username,
         password=login.password,
         mfa_token=login.mfa_token,
@@ -520,6 +528,7 @@ async def login(request: Request, login: Login):
 
         return JSONResponse(status_code=status_code, content=response_content)
 
+    credential_service.record_login_success(login.username)
     return JSONResponse(
         status_code=200,
         content={
@@ -695,7 +704,9 @@ async def disable_mfa(
     Requires either password or current MFA token for verification.
     """
     auth = MagicalAuth(token=authorization)
-    result = auth.disable_mfa(password=request.password, mfa_token=request.mfa_token)
+    result = await asyncio.to_thread(
+        auth.disable_mfa, password=request.password, mfa_token=request.mfa_token
+    )
 
     if result.get("status_code", 500) != 200:
         raise HTTPException(
@@ -722,7 +733,8 @@ async def change_password(
     Requires current password for verification.
     """
     auth = MagicalAuth(token=authorization)
-    result = auth.change_password(
+    result = await asyncio.to_thread(
+        auth.change_password,
         current_password=request.current_password,
         new_password=request.new_password,
         confirm_password=request.confirm_password,
@@ -752,7 +764,8 @@ async def set_password(
     Set a password for users who don't have one (e.g., migrating from magic link).
     """
     auth = MagicalAuth(token=authorization)
-    result = auth.set_password(
+    result = await asyncio.to_thread(
+        auth.set_password,
         new_password=request.new_password,
         confirm_password=request.confirm_password,
     )
@@ -901,8 +914,11 @@ async def logout_user(
 
         # Invalidate the token validation cache for this token
         from MagicalAuth import invalidate_token_validation_cache
+        from AuthContext import auth_context_resolver
 
         invalidate_token_validation_cache(token)
+        # Add it to the cached revoked token set every worker checks
+        auth_context_resolver.revoke(token)
 
         # Cleanup expired tokens (optional - can be done periodically)
         expired_tokens = (
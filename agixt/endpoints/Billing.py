@@ -1,7 +1,9 @@
+import asyncio
 import os
 import uuid
 from fastapi import APIRouter, Header, HTTPException, Depends, Query
-from typing import Optional, List, Dict, Any
+from fastapi.responses import StreamingResponse
+from typing import Optional, List, Dict, Any, Iterator
 from pydantic import BaseModel, Field
 from datetime import datetime, timezone
 from MagicalAuth import (
@@ -22,13 +24,34 @@ from middleware import (
 from DB import (
     PaymentTransaction,
     CompanyTokenUsage,
+    UsageRollup,
     Company,
     User,
     UserCompany,
     UserPreferences,
     get_session,
 )
-from sqlalchemy import desc
+from BillingAnalytics import (
+    EXPORT_BATCH_SIZE,
+    GRANULARITIES,
+    GRANULARITY_ALL,
+    SCOPE_COMPANY,
+    SCOPE_USER,
+    SCOPES,
+    bucket_start,
+    iter_csv,
+    iter_json_document,
+    iter_ndjson,
+    keyset_page,
+    parse_date,
+    rollup_rows,
+    rollup_to_dict,
+    usage_rollups,
+    usage_totals,
+)
+from MemoryTransfer import NDJSON_MEDIA_TYPE
+from Entitlements import entitlements
+from sqlalchemy import String, cast, desc, func
 import logging
 
 app = APIRouter()
@@ -2951,18 +2974,137 @@ async def admin_impersonate_user(
 # ============================================
 
 
+EXPORT_COMPANY_COLUMNS = [
+    "company_id",
+    "company_name",
+    "company_email",
+    "company_phone",
+    "company_website",
+    "company_address",
+    "company_city",
+    "company_state",
+    "company_zip",
+    "company_country",
+    "company_notes",
+    "company_status",
+    "token_balance",
+    "token_balance_usd",
+    "user_id",
+    "user_email",
+    "user_first_name",
+    "user_last_name",
+    "user_role",
+]
+
+EXPORT_USAGE_COLUMNS = [
+    "bucket_start",
+    "granularity",
+    "scope",
+    "subject_id",
+    "company_id",
+    "input_tokens",
+    "output_tokens",
+    "total_tokens",
+    "usage_count",
+]
+
+
+def export_response(columns, rows, export_format: str, name: str):
+    """Stream `rows` as a CSV, NDJSON or JSON download"""
+    if export_format == "csv":
+        return StreamingResponse(
+            iter_csv(columns, rows),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{name}.csv"'},
+        )
+    if export_format == "ndjson":
+        return StreamingResponse(
+            iter_ndjson(rows),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{name}.ndjson"'},
+        )
+    return StreamingResponse(
+        iter_json_document(columns, rows), media_type="application/json"
+    )
+
+
+def iter_company_export_rows() -> Iterator[Dict[str, Any]]:
+    """Companies with one row per member, read a batch of companies at a time"""
+    role_names = {0: "Super Admin", 1: "Admin", 2: "Manager", 3: "User"}
+    session = get_session()
+    try:
+        last_id = None
+        while True:
+            query = session.query(Company).order_by(Company.id)
+            if last_id is not None:
+                query = query.filter(Company.id > last_id)
+            companies = query.limit(EXPORT_BATCH_SIZE).all()
+            if not companies:
+                return
+            last_id = companies[-1].id
+            members = {}
+            for uc, user in (
+                session.query(UserCompany, User)
+                .join(User, User.id == UserCompany.user_id)
+                .filter(UserCompany.company_id.in_([c.id for c in companies]))
+            ):
+                members.setdefault(uc.company_id, []).append((uc, user))
+            for company in companies:
+                row = {
+                    "company_id": str(company.id),
+                    "company_name": company.name,
+                    "company_email": company.email or "",
+                    "company_phone": company.phone_number or "",
+                    "company_website": company.website or "",
+                    "company_address": company.address or "",
+                    "company_city": company.city or "",
+                    "company_state": company.state or "",
+                    "company_zip": company.zip_code or "",
+                    "company_country": company.country or "",
+                    "company_notes": company.notes or "",
+                    "company_status": (
+                        "Active" if getattr(company, "status", True) else "Suspended"
+                    ),
+                    "token_balance": getattr(company, "token_balance", 0) or 0,
+                    "token_balance_usd": getattr(company, "token_balance_usd", 0) or 0,
+                    "user_id": "",
+                    "user_email": "",
+                    "user_first_name": "",
+                    "user_last_name": "",
+                    "user_role": "",
+                }
+                if not members.get(company.id):
+                    # Company with no users
+                    yield row
+                    continue
+                for uc, user in members[company.id]:
+                    yield {
+                        **row,
+                        "user_id": str(user.id),
+                        "user_email": user.email,
+                        "user_first_name": user.first_name or "",
+                        "user_last_name": user.last_name or "",
+                        "user_role": role_names.get(uc.role_id, "User"),
+                    }
+            # Keep memory flat however many companies there are
+            session.expunge_all()
+    finally:
+        session.close()
+
+
 @app.get(
     "/v1/admin/export/companies",
     tags=["Admin"],
     summary="Export all companies data (super admin only)",
-    description="Returns all companies with their users in a format suitable for CSV export.",
+    description="Streams all companies with their users in a format suitable for CSV export. `format` is json (columns, rows and total_rows), csv or ndjson.",
 )
 async def admin_export_companies(
+    format: str = Query("json", description="json, csv or ndjson"),
     authorization: str = Header(None),
 ):
     """
     Export all companies and users for reporting.
-    Returns data in a flat structure suitable for CSV.
+    Returns data in a flat structure suitable for CSV, streamed as it is read.
     """
     auth = MagicalAuth(token=authorization)
     if not auth.is_super_admin():
@@ -2970,121 +3112,60 @@ async def admin_export_companies(
             status_code=403,
             detail="Unauthorized. Super admin permissions required.",
         )
-
-    session = get_session()
-    try:
-        from sqlalchemy.orm import joinedload
-
-        companies = (
-            session.query(Company)
-            .options(
-                joinedload(Company.users).joinedload(UserCompany.user),
-                joinedload(Company.users).joinedload(UserCompany.role),
-            )
-            .all()
+    if format not in ("json", "csv", "ndjson"):
+        raise HTTPException(
+            status_code=400, detail="format must be json, csv or ndjson"
         )
+    return export_response(
+        EXPORT_COMPANY_COLUMNS, iter_company_export_rows(), format, "companies"
+    )
 
-        rows = []
-        role_names = {0: "Super Admin", 1: "Admin", 2: "Manager", 3: "User"}
 
-        for company in companies:
-            if not company.users:
-                # Company with no users
-                rows.append(
-                    {
-                        "company_id": str(company.id),
-                        "company_name": company.name,
-                        "company_email": company.email or "",
-                        "company_phone": company.phone_number or "",
-                        "company_website": company.website or "",
-                        "company_address": company.address or "",
-                        "company_city": company.city or "",
-                        "company_state": company.state or "",
-                        "company_zip": company.zip_code or "",
-                        "company_country": company.country or "",
-                        "company_notes": company.notes or "",
-                        "company_status": (
-                            "Active"
-                            if getattr(company, "status", True)
-                            else "Suspended"
-                        ),
-                        "token_balance": getattr(company, "token_balance", 0) or 0,
-                        "token_balance_usd": getattr(company, "token_balance_usd", 0)
-                        or 0,
-                        "user_id": "",
-                        "user_email": "",
-                        "user_first_name": "",
-                        "user_last_name": "",
-                        "user_role": "",
-                    }
-                )
-            else:
-                for uc in company.users:
-                    user = uc.user
-                    rows.append(
-                        {
-                            "company_id": str(company.id),
-                            "company_name": company.name,
-                            "company_email": company.email or "",
-                            "company_phone": company.phone_number or "",
-                            "company_website": company.website or "",
-                            "company_address": company.address or "",
-                            "company_city": company.city or "",
-                            "company_state": company.state or "",
-                            "company_zip": company.zip_code or "",
-                            "company_country": company.country or "",
-                            "company_notes": company.notes or "",
-                            "company_status": (
-                                "Active"
-                                if getattr(company, "status", True)
-                                else "Suspended"
-                            ),
-                            "token_balance": getattr(company, "token_balance", 0) or 0,
-                            "token_balance_usd": getattr(
-                                company, "token_balance_usd", 0
-                            )
-                            or 0,
-                            "user_id": str(user.id),
-                            "user_email": user.email,
-                            "user_first_name": user.first_name or "",
-                            "user_last_name": user.last_name or "",
-                            "user_role": role_names.get(uc.role_id, "User"),
-                        }
-                    )
+@app.get(
+    "/v1/admin/export/usage",
+    tags=["Admin", "Analytics"],
+    summary="Export token usage rollups (super admin only)",
+    description="Streams hourly, daily or all-time token usage per company, user or agent from the usage rollups as csv, ndjson or json.",
+)
+async def admin_export_usage(
+    granularity: str = Query("day", description="hour, day or all"),
+    scope: str = Query("company", description="company, user or agent"),
+    start_date: Optional[str] = Query(None, description="Start date (ISO format)"),
+    end_date: Optional[str] = Query(None, description="End date (ISO format)"),
+    company_id: Optional[str] = Query(None, description="Only this company"),
+    format: str = Query("csv", description="csv, ndjson or json"),
+    authorization: str = Header(None),
+):
+    auth = MagicalAuth(token=authorization)
+    if not auth.is_super_admin():
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied. Super admin role required.",
+        )
+    start_dt, end_dt = _rollup_query_params(granularity, scope, start_date, end_date)
+    if format not in ("json", "csv", "ndjson"):
+        raise HTTPException(
+            status_code=400, detail="format must be json, csv or ndjson"
+        )
 
-        return {
-            "columns": [
-                "company_id",
-                "company_name",
-                "company_email",
-                "company_phone",
-                "company_website",
-                "company_address",
-                "company_city",
-                "company_state",
-                "company_zip",
-                "company_country",
-                "company_notes",
-                "company_status",
-                "token_balance",
-                "token_balance_usd",
-                "user_id",
-                "user_email",
-                "user_first_name",
-                "user_last_name",
-                "user_role",
-            ],
-            "rows": rows,
-            "total_rows": len(rows),
-        }
+    def rows():
+        session = get_session()
+        try:
+            yield from rollup_rows(
+                session,
+                UsageRollup,
+                granularity,
+                scope,
+                start=start_dt,
+                end=end_dt,
+                company_id=company_id,
+            )
+        finally:
+            session.close()
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logging.error(f"Error exporting companies: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to export companies")
-    finally:
-        session.close()
+    return export_response(
+        EXPORT_USAGE_COLUMNS, rows(), format, f"usage-{scope}-{granularity}"
+    )
 
 
 # ============================================
@@ -3343,11 +3424,44 @@ class AnalyticsDateRange(BaseModel):
     end_date: Optional[datetime] = None
 
 
+def _parse_date_range(start_date: Optional[str], end_date: Optional[str]):
+    try:
+        return (
+            parse_date(start_date, "start_date"),
+            parse_date(end_date, "end_date"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _rollup_query_params(
+    granularity: str,
+    scope: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=400, detail="granularity must be hour, day or all"
+        )
+    if scope not in SCOPES:
+        raise HTTPException(
+            status_code=400, detail="scope must be company, user or agent"
+        )
+    return _parse_date_range(start_date, end_date)
+
+
+def _sort_column(sort_by: Optional[str]) -> str:
+    if sort_by in ("input_tokens", "output_tokens"):
+        return sort_by
+    return "total_tokens"
+
+
 @app.get(
     "/v1/admin/analytics/usage",
     tags=["Admin", "Analytics"],
     summary="Get server-wide token usage analytics (super admin only)",
-    description="Returns aggregated token usage statistics across all companies and users. Works regardless of billing status.",
+    description="Returns aggregated token usage statistics across all companies and users from the usage rollups. Works regardless of billing status. Pass `next_cursor` back as `cursor` for the next page.",
 )
 async def admin_get_usage_analytics(
     start_date: Optional[str] = Query(None, description="Start date (ISO format)"),
@@ -3358,23 +3472,23 @@ async def admin_get_usage_analytics(
     sort_direction: Optional[str] = Query(
         "desc", description="Sort direction: asc, desc"
     ),
-    limit: int = Query(100, description="Max companies to return"),
-    offset: int = Query(0, description="Offset for pagination"),
+    limit: int = Query(100, ge=1, le=1000, description="Max companies to return"),
+    offset: int = Query(0, ge=0, description="Offset for pagination"),
+    cursor: Optional[str] = Query(
+        None, description="Cursor from the previous page; used instead of offset"
+    ),
     authorization: str = Header(None),
 ):
     """
     Get server-wide token usage analytics (super admin only).
 
-    Returns aggregated token usage per company including:
-    - Total tokens used per company (from CompanyTokenUsage audit trail)
-    - Per-user breakdown within each company
-    - Total input/output tokens
+    Returns token usage per company, ranked by all-time usage:
+    - Usage in the date range (audit_*), at hour resolution
+    - All-time usage (cumulative_*)
     - User count per company
 
     This endpoint works regardless of whether billing is enabled.
     """
-    from sqlalchemy import func, case
-
     auth = MagicalAuth(token=authorization)
     if not auth.is_super_admin():
         raise HTTPException(
@@ -3382,191 +3496,123 @@ async def admin_get_usage_analytics(
             detail="Access denied. Super admin role required.",
         )
 
+    start_dt, end_dt = _parse_date_range(start_date, end_date)
     session = get_session()
     try:
-        # Parse date filters
-        start_dt = None
-        end_dt = None
-        if start_date:
-            try:
-                start_dt = datetime.fromisoformat(start_date.replace("Z", "+00:00"))
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid start_date format")
-        if end_date:
-            try:
-                end_dt = datetime.fromisoformat(end_date.replace("Z", "+00:00"))
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid end_date format")
-
-        # Get all companies with user counts
-        companies = session.query(Company).all()
-        company_ids = [c.id for c in companies]
+        sort_column = _sort_column(sort_by)
+        descending = (sort_direction or "desc").lower() == "desc"
 
-        # Batch load user counts per company
-        user_counts_query = (
+        # One all-time row per company
+        totals = (
             session.query(
-                UserCompany.company_id,
-                func.count(UserCompany.id).label("user_count"),
+                UsageRollup.subject_id,
+                UsageRollup.input_tokens,
+                UsageRollup.output_tokens,
+                UsageRollup.total_tokens,
             )
-            .filter(UserCompany.company_id.in_(company_ids))
-            .group_by(UserCompany.company_id)
-            .all()
+            .filter(
+                UsageRollup.granularity == GRANULARITY_ALL,
+                UsageRollup.scope == SCOPE_COMPANY,
+            )
+            .subquery()
         )
-        user_counts_map = {row.company_id: row.user_count for row in user_counts_query}
-
-        # Batch load CompanyTokenUsage aggregates per company
-        usage_base_query = session.query(
-            CompanyTokenUsage.company_id,
-            func.coalesce(func.sum(CompanyTokenUsage.input_tokens), 0).label(
-                "input_tokens"
-            ),
-            func.coalesce(func.sum(CompanyTokenUsage.output_tokens), 0).label(
-                "output_tokens"
-            ),
-            func.coalesce(func.sum(CompanyTokenUsage.total_tokens), 0).label(
-                "total_tokens"
-            ),
-            func.count(CompanyTokenUsage.id).label("usage_count"),
-        ).filter(CompanyTokenUsage.company_id.in_(company_ids))
-
-        if start_dt:
-            usage_base_query = usage_base_query.filter(
-                CompanyTokenUsage.timestamp >= start_dt
+        company_key = cast(Company.id, String)
+        sort_value = func.coalesce(totals.c[sort_column], 0)
+        query = session.query(
+            Company,
+            totals.c.input_tokens,
+            totals.c.output_tokens,
+            sort_value.label("sort_value"),
+            company_key.label("company_key"),
+        ).outerjoin(totals, totals.c.subject_id == company_key)
+        if cursor is None and offset:
+            query = query.offset(offset)
+        try:
+            page, next_cursor = keyset_page(
+                query,
+                [sort_value, company_key],
+                cursor,
+                limit,
+                descending,
+                key=lambda row: (row.sort_value, row.company_key),
             )
-        if end_dt:
-            usage_base_query = usage_base_query.filter(
-                CompanyTokenUsage.timestamp <= end_dt
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        page_ids = [row.Company.id for row in page]
+        user_counts_map = (
+            dict(
+                session.query(UserCompany.company_id, func.count(UserCompany.id))
+                .filter(UserCompany.company_id.in_(page_ids))
+                .group_by(UserCompany.company_id)
+                .all()
             )
-
-        usage_results = usage_base_query.group_by(CompanyTokenUsage.company_id).all()
-        usage_map = {
-            row.company_id: {
-                "input_tokens": int(row.input_tokens),
-                "output_tokens": int(row.output_tokens),
-                "total_tokens": int(row.total_tokens),
-                "usage_count": int(row.usage_count),
-            }
-            for row in usage_results
-        }
-
-        # Batch load all UserCompany records
-        all_user_companies = (
-            session.query(UserCompany)
-            .filter(UserCompany.company_id.in_(company_ids))
-            .all()
+            if page_ids
+            else {}
         )
-        # Group by company_id
-        company_users_map = {}
-        all_user_ids = set()
-        for uc in all_user_companies:
-            if uc.company_id not in company_users_map:
-                company_users_map[uc.company_id] = []
-            company_users_map[uc.company_id].append(uc)
-            all_user_ids.add(uc.user_id)
-
-        # Batch load all UserPreferences for token counts
-        all_prefs = (
-            session.query(UserPreferences)
-            .filter(
-                UserPreferences.user_id.in_(all_user_ids),
-                UserPreferences.pref_key.in_(["input_tokens", "output_tokens"]),
-            )
-            .all()
+        range_usage = usage_totals(
+            session,
+            UsageRollup,
+            SCOPE_COMPANY,
+            start=start_dt,
+            end=end_dt,
+            subject_ids=[str(company_id) for company_id in page_ids],
         )
-        # Build lookup: {user_id: {pref_key: pref_value}}
-        prefs_map = {}
-        for pref in all_prefs:
-            if pref.user_id not in prefs_map:
-                prefs_map[pref.user_id] = {}
-            prefs_map[pref.user_id][pref.pref_key] = pref.pref_value
 
-        company_data = {}
-
-        for company in companies:
+        company_list = []
+        for row in page:
+            company = row.Company
             company_id = str(company.id)
+            usage_result = range_usage.get(company_id, {})
+            cumulative_input = int(row.input_tokens or 0)
+            cumulative_output = int(row.output_tokens or 0)
+            company_list.append(
+                {
+                    "company_id": company_id,
+                    "company_name": company.name,
+                    "status": getattr(company, "status", True),
+                    "user_count": user_counts_map.get(company.id, 0),
+                    "token_balance": getattr(company, "token_balance", 0) or 0,
+                    "token_balance_usd": getattr(company, "token_balance_usd", 0) or 0,
+                    "tokens_used_total": getattr(company, "tokens_used_total", 0) or 0,
+                    # Usage in the date range
+                    "audit_input_tokens": usage_result.get("input_tokens", 0),
+                    "audit_output_tokens": usage_result.get("output_tokens", 0),
+                    "audit_total_tokens": usage_result.get("total_tokens", 0),
+                    "audit_usage_count": usage_result.get("usage_count", 0),
+                    # All-time usage
+                    "cumulative_input_tokens": cumulative_input,
+                    "cumulative_output_tokens": cumulative_output,
+                    "cumulative_total_tokens": cumulative_input + cumulative_output,
+                }
+            )
 
-            user_count = user_counts_map.get(company.id, 0)
-            usage_result = usage_map.get(company.id)
-
-            # Calculate cumulative from UserPreferences for users in this company
-            cumulative_input = 0
-            cumulative_output = 0
-            for uc in company_users_map.get(company.id, []):
-                user_prefs = prefs_map.get(uc.user_id, {})
-                input_val = user_prefs.get("input_tokens")
-                output_val = user_prefs.get("output_tokens")
-                if input_val:
-                    try:
-                        cumulative_input += int(input_val)
-                    except (ValueError, TypeError):
-                        pass
-                if output_val:
-                    try:
-                        cumulative_output += int(output_val)
-                    except (ValueError, TypeError):
-                        pass
-
-            company_data[company_id] = {
-                "company_id": company_id,
-                "company_name": company.name,
-                "status": getattr(company, "status", True),
-                "user_count": user_count,
-                "token_balance": getattr(company, "token_balance", 0) or 0,
-                "token_balance_usd": getattr(company, "token_balance_usd", 0) or 0,
-                "tokens_used_total": getattr(company, "tokens_used_total", 0) or 0,
-                # Audit trail usage (from CompanyTokenUsage)
-                "audit_input_tokens": (
-                    int(usage_result["input_tokens"]) if usage_result else 0
-                ),
-                "audit_output_tokens": (
-                    int(usage_result["output_tokens"]) if usage_result else 0
-                ),
-                "audit_total_tokens": (
-                    int(usage_result["total_tokens"]) if usage_result else 0
-                ),
-                "audit_usage_count": (
-                    int(usage_result["usage_count"]) if usage_result else 0
-                ),
-                # Cumulative usage (from UserPreferences)
-                "cumulative_input_tokens": cumulative_input,
-                "cumulative_output_tokens": cumulative_output,
-                "cumulative_total_tokens": cumulative_input + cumulative_output,
-            }
-
-        # Convert to list and sort
-        company_list = list(company_data.values())
-
-        # Determine sort key
-        if sort_by == "input_tokens":
-            sort_key = "cumulative_input_tokens"
-        elif sort_by == "output_tokens":
-            sort_key = "cumulative_output_tokens"
-        else:
-            sort_key = "cumulative_total_tokens"
-
-        reverse = sort_direction.lower() == "desc"
-        company_list.sort(key=lambda x: x.get(sort_key, 0), reverse=reverse)
-
-        # Calculate totals
-        total_input = sum(c["cumulative_input_tokens"] for c in company_list)
-        total_output = sum(c["cumulative_output_tokens"] for c in company_list)
-        total_tokens = total_input + total_output
-
-        # Apply pagination
-        total_companies = len(company_list)
-        paginated = company_list[offset : offset + limit]
+        total_input, total_output = (
+            session.query(
+                func.coalesce(func.sum(UsageRollup.input_tokens), 0),
+                func.coalesce(func.sum(UsageRollup.output_tokens), 0),
+            )
+            .filter(
+                UsageRollup.granularity == GRANULARITY_ALL,
+                UsageRollup.scope == SCOPE_COMPANY,
+            )
+            .one()
+        )
+        total_companies = session.query(func.count(Company.id)).scalar()
+        total_users = session.query(func.count(UserCompany.id)).scalar()
 
         return {
-            "companies": paginated,
+            "companies": company_list,
             "total": total_companies,
             "limit": limit,
             "offset": offset,
+            "next_cursor": next_cursor,
             "summary": {
-                "total_input_tokens": total_input,
-                "total_output_tokens": total_output,
-                "total_tokens": total_tokens,
+                "total_input_tokens": int(total_input),
+                "total_output_tokens": int(total_output),
+                "total_tokens": int(total_input) + int(total_output),
                 "total_companies": total_companies,
-                "total_users": sum(c["user_count"] for c in company_list),
+                "total_users": total_users,
             },
             "date_range": {
                 "start_date": start_date,
@@ -3600,7 +3646,8 @@ async def admin_get_company_usage_analytics(
 
     Returns per-user breakdown including:
     - User email and name
-    - Input/output/total tokens per user
+    - Input/output/total tokens per user in the company, for the date range
+      (at hour resolution) or all time
     - Recent usage records from audit trail
     """
     auth = MagicalAuth(token=authorization)
@@ -3610,6 +3657,7 @@ async def admin_get_company_usage_analytics(
             detail="Access denied. Super admin role required.",
         )
 
+    start_dt, end_dt = _parse_date_range(start_date, end_date)
     session = get_session()
     try:
         # Verify company exists
@@ -3617,20 +3665,6 @@ async def admin_get_company_usage_analytics(
         if not company:
             raise HTTPException(status_code=404, detail="Company not found")
 
-        # Parse date filters
-        start_dt = None
-        end_dt = None
-        if start_date:
-            try:
-                start_dt = datetime.fromisoformat(start_date.replace("Z", "+00:00"))
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid start_date format")
-        if end_date:
-            try:
-                end_dt = datetime.fromisoformat(end_date.replace("Z", "+00:00"))
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid end_date format")
-
         # Get all users in this company
         user_companies = (
             session.query(UserCompany)
@@ -3674,43 +3708,44 @@ async def admin_get_company_usage_analytics(
             roles = session.query(UserRole).filter(UserRole.id.in_(role_ids)).all()
             roles_map = {r.id: r for r in roles}
 
-        # Batch load preferences
-        prefs = (
-            session.query(UserPreferences)
-            .filter(
-                UserPreferences.user_id.in_(user_ids),
-                UserPreferences.pref_key.in_(["input_tokens", "output_tokens"]),
-            )
-            .all()
+        usage_by_user = usage_totals(
+            session,
+            UsageRollup,
+            SCOPE_USER,
+            start=start_dt,
+            end=end_dt,
+            company_id=str(company.id),
         )
-        prefs_map = {}
-        for pref in prefs:
-            if pref.user_id not in prefs_map:
-                prefs_map[pref.user_id] = {}
-            prefs_map[pref.user_id][pref.pref_key] = pref.pref_value
 
-        # Build audit query base
-        audit_query = session.query(CompanyTokenUsage).filter(
+        # The 50 most recent audit records of each user
+        ranked = session.query(
+            CompanyTokenUsage.user_id,
+            CompanyTokenUsage.input_tokens,
+            CompanyTokenUsage.output_tokens,
+            CompanyTokenUsage.total_tokens,
+            CompanyTokenUsage.timestamp,
+            func.row_number()
+            .over(
+                partition_by=CompanyTokenUsage.user_id,
+                order_by=desc(CompanyTokenUsage.timestamp),
+            )
+            .label("position"),
+        ).filter(
             CompanyTokenUsage.company_id == company_id,
             CompanyTokenUsage.user_id.in_(user_ids),
         )
         if start_dt:
-            audit_query = audit_query.filter(CompanyTokenUsage.timestamp >= start_dt)
+            ranked = ranked.filter(CompanyTokenUsage.timestamp >= start_dt)
         if end_dt:
-            audit_query = audit_query.filter(CompanyTokenUsage.timestamp <= end_dt)
-
-        # Get all audit records (we'll group them by user_id after)
-        all_audit_records = audit_query.order_by(
-            desc(CompanyTokenUsage.timestamp)
-        ).all()
-
-        # Group audit records by user_id and limit to 50 each
+            ranked = ranked.filter(CompanyTokenUsage.timestamp <= end_dt)
+        ranked = ranked.subquery()
         audit_by_user = {}
-        for record in all_audit_records:
-            if record.user_id not in audit_by_user:
-                audit_by_user[record.user_id] = []
-            if len(audit_by_user[record.user_id]) < 50:
-                audit_by_user[record.user_id].append(record)
+        for record in (
+            session.query(ranked)
+            .filter(ranked.c.position <= 50)
+            .order_by(ranked.c.user_id, ranked.c.position)
+        ):
+            audit_by_user.setdefault(record.user_id, []).append(record)
 
         users_data = []
         for uc in user_companies:
@@ -3721,17 +3756,9 @@ async def admin_get_company_usage_analytics(
             role = roles_map.get(uc.role_id)
             role_name = role.friendly_name if role else f"Role {uc.role_id}"
 
-            user_prefs = prefs_map.get(uc.user_id, {})
-            input_tokens = 0
-            output_tokens = 0
-            try:
-                input_tokens = int(user_prefs.get("input_tokens", 0) or 0)
-            except (ValueError, TypeError):
-                pass
-            try:
-                output_tokens = int(user_prefs.get("output_tokens", 0) or 0)
-            except (ValueError, TypeError):
-                pass
+            usage = usage_by_user.get(str(uc.user_id), {})
+            input_tokens = usage.get("input_tokens", 0)
+            output_tokens = usage.get("output_tokens", 0)
 
             audit_records = audit_by_user.get(uc.user_id, [])
 
@@ -3804,7 +3831,7 @@ async def admin_get_company_usage_analytics(
     "/v1/admin/analytics/usage/users",
     tags=["Admin", "Analytics"],
     summary="Get all users' token usage across the server (super admin only)",
-    description="Returns a flat list of all users with their token usage, sorted by usage.",
+    description="Returns a flat list of all users with their token usage, sorted by usage. Pass `next_cursor` back as `cursor` for the next page.",
 )
 async def admin_get_all_users_usage(
     sort_by: Optional[str] = Query(
@@ -3813,17 +3840,20 @@ async def admin_get_all_users_usage(
     sort_direction: Optional[str] = Query(
         "desc", description="Sort direction: asc, desc"
     ),
-    limit: int = Query(100, description="Max users to return"),
-    offset: int = Query(0, description="Offset for pagination"),
+    limit: int = Query(100, ge=1, le=1000, description="Max users to return"),
+    offset: int = Query(0, ge=0, description="Offset for pagination"),
+    cursor: Optional[str] = Query(
+        None, description="Cursor from the previous page; used instead of offset"
+    ),
     authorization: str = Header(None),
 ):
     """
     Get all users' token usage across the server (super admin only).
 
-    Returns a flat list of all users with:
+    Returns a list of users with:
     - User details (email, name)
-    - Company association
-    - Total input/output/tokens
+    - Company association (one entry per company the user belongs to)
+    - All-time input/output/total tokens
     """
     auth = MagicalAuth(token=authorization)
     if not auth.is_super_admin():
@@ -3834,98 +3864,101 @@ async def admin_get_all_users_usage(
 
     session = get_session()
     try:
-        from sqlalchemy import func, case, literal_column
-        from sqlalchemy.orm import aliased
-
-        input_pref = aliased(UserPreferences)
-        output_pref = aliased(UserPreferences)
+        sort_column = _sort_column(sort_by)
+        descending = (sort_direction or "desc").lower() == "desc"
 
-        # Single query with LEFT JOINs to batch-load all related data
-        base_query = (
+        # All-time usage per user, across the companies it was billed to
+        totals = (
             session.query(
-                User.id,
-                User.email,
-                User.first_name,
-                User.last_name,
-                UserCompany.company_id,
-                Company.name.label("company_name"),
-                input_pref.pref_value.label("input_tokens_str"),
-                output_pref.pref_value.label("output_tokens_str"),
-            )
-            .outerjoin(UserCompany, UserCompany.user_id == User.id)
-            .outerjoin(Company, Company.id == UserCompany.company_id)
-            .outerjoin(
-                input_pref,
-                (input_pref.user_id == User.id)
-                & (input_pref.pref_key == "input_tokens"),
-            )
-            .outerjoin(
-                output_pref,
-                (output_pref.user_id == User.id)
-                & (output_pref.pref_key == "output_tokens"),
-            )
-        )
-
-        # Get total count first
-        total_users = base_query.count()
-
-        # Build rows and parse token values
-        rows = base_query.all()
-        users_data = []
-        total_input = 0
-        total_output = 0
-        for row in rows:
-            try:
-                input_tokens = int(row.input_tokens_str) if row.input_tokens_str else 0
-            except (ValueError, TypeError):
-                input_tokens = 0
-            try:
-                output_tokens = (
-                    int(row.output_tokens_str) if row.output_tokens_str else 0
-                )
-            except (ValueError, TypeError):
-                output_tokens = 0
-            total_input += input_tokens
-            total_output += output_tokens
-            users_data.append(
-                {
-                    "user_id": str(row.id),
-                    "email": row.email,
-                    "first_name": row.first_name or "",
-                    "last_name": row.last_name or "",
-                    "company_id": str(row.company_id) if row.company_id else None,
-                    "company_name": row.company_name or "No Company",
-                    "input_tokens": input_tokens,
-                    "output_tokens": output_tokens,
-                    "total_tokens": input_tokens + output_tokens,
-                }
+                UsageRollup.subject_id,
+                func.sum(UsageRollup.input_tokens).label("input_tokens"),
+                func.sum(UsageRollup.output_tokens).label("output_tokens"),
+                func.sum(UsageRollup.total_tokens).label("total_tokens"),
             )
+            .filter(
+                UsageRollup.granularity == GRANULARITY_ALL,
+                UsageRollup.scope == SCOPE_USER,
+            )
+            .group_by(UsageRollup.subject_id)
+            .subquery()
+        )
+        user_key = cast(User.id, String)
+        sort_value = func.coalesce(totals.c[sort_column], 0)
+        query = session.query(
+            User.id,
+            User.email,
+            User.first_name,
+            User.last_name,
+            totals.c.input_tokens,
+            totals.c.output_tokens,
+            sort_value.label("sort_value"),
+            user_key.label("user_key"),
+        ).outerjoin(totals, totals.c.subject_id == user_key)
+        if cursor is None and offset:
+            query = query.offset(offset)
+        try:
+            page, next_cursor = keyset_page(
+                query,
+                [sort_value, user_key],
+                cursor,
+                limit,
+                descending,
+                key=lambda row: (row.sort_value, row.user_key),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        memberships = {}
+        if page:
+            for user_id, company_id, company_name in (
+                session.query(UserCompany.user_id, Company.id, Company.name)
+                .join(Company, Company.id == UserCompany.company_id)
+                .filter(UserCompany.user_id.in_([row.id for row in page]))
+            ):
+                memberships.setdefault(user_id, []).append((company_id, company_name))
 
-        # Sort in Python (token values are parsed from strings, hard to sort in DB)
-        if sort_by == "input_tokens":
-            sort_key = "input_tokens"
-        elif sort_by == "output_tokens":
-            sort_key = "output_tokens"
-        else:
-            sort_key = "total_tokens"
-
-        reverse = sort_direction.lower() == "desc"
-        users_data.sort(key=lambda x: x.get(sort_key, 0), reverse=reverse)
-
-        total_tokens = total_input + total_output
+        users_data = []
+        for row in page:
+            input_tokens = int(row.input_tokens or 0)
+            output_tokens = int(row.output_tokens or 0)
+            for company_id, company_name in memberships.get(row.id, [(None, None)]):
+                users_data.append(
+                    {
+                        "user_id": str(row.id),
+                        "email": row.email,
+                        "first_name": row.first_name or "",
+                        "last_name": row.last_name or "",
+                        "company_id": str(company_id) if company_id else None,
+                        "company_name": company_name or "No Company",
+                        "input_tokens": input_tokens,
+                        "output_tokens": output_tokens,
+                        "total_tokens": input_tokens + output_tokens,
+                    }
+                )
 
-        # Apply pagination
-        paginated = users_data[offset : offset + limit]
+        total_input, total_output = (
+            session.query(
+                func.coalesce(func.sum(UsageRollup.input_tokens), 0),
+                func.coalesce(func.sum(UsageRollup.output_tokens), 0),
+            )
+            .filter(
+                UsageRollup.granularity == GRANULARITY_ALL,
+                UsageRollup.scope == SCOPE_USER,
+            )
+            .one()
+        )
+        total_users = session.query(func.count(User.id)).scalar()
 
         return {
-            "users": paginated,
+            "users": users_data,
             "total": total_users,
             "limit": limit,
             "offset": offset,
+            "next_cursor": next_cursor,
             "summary": {
-                "total_input_tokens": total_input,
-                "total_output_tokens": total_output,
-                "total_tokens": total_tokens,
+                "total_input_tokens": int(total_input),
+                "total_output_tokens": int(total_output),
+                "total_tokens": int(total_input) + int(total_output),
                 "total_users": total_users,
             },
         }
@@ -3939,6 +3972,127 @@ async def admin_get_all_users_usage(
         session.close()
 
 
+@app.get(
+    "/v1/admin/analytics/usage/rollups",
+    tags=["Admin", "Analytics"],
+    summary="Get hourly or daily token usage series (super admin only)",
+    description="Returns usage rollup rows per company, user or agent in bucket order. Pass `next_cursor` back as `cursor` for the next page.",
+)
+async def admin_get_usage_rollups(
+    granularity: str = Query("day", description="hour, day or all"),
+    scope: str = Query("company", description="company, user or agent"),
+    start_date: Optional[str] = Query(None, description="Start date (ISO format)"),
+    end_date: Optional[str] = Query(None, description="End date (ISO format)"),
+    company_id: Optional[str] = Query(None, description="Only this company"),
+    subject_id: Optional[str] = Query(
+        None, description="Only this company, user or agent"
+    ),
+    limit: int = Query(500, ge=1, le=5000),
+    cursor: Optional[str] = Query(None),
+    authorization: str = Header(None),
+):
+    auth = MagicalAuth(token=authorization)
+    if not auth.is_super_admin():
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied. Super admin role required.",
+        )
+    start_dt, end_dt = _rollup_query_params(granularity, scope, start_date, end_date)
+
+    session = get_session()
+    try:
+        query = session.query(UsageRollup).filter(
+            UsageRollup.granularity == granularity, UsageRollup.scope == scope
+        )
+        if start_dt:
+            query = query.filter(
+                UsageRollup.bucket_start >= bucket_start(start_dt, granularity)
+            )
+        if end_dt:
+            query = query.filter(UsageRollup.bucket_start <= end_dt)
+        if company_id:
+            query = query.filter(UsageRollup.company_id == company_id)
+        if subject_id:
+            query = query.filter(UsageRollup.subject_id == subject_id)
+        try:
+            page, next_cursor = keyset_page(
+                query,
+                [
+                    UsageRollup.bucket_start,
+                    UsageRollup.subject_id,
+                    UsageRollup.company_id,
+                ],
+                cursor,
+                limit,
+                False,
+                key=lambda row: (row.bucket_start, row.subject_id, row.company_id),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {
+            "rollups": [rollup_to_dict(row) for row in page],
+            "limit": limit,
+            "next_cursor": next_cursor,
+        }
+    finally:
+        session.close()
+
+
+@app.get(
+    "/v1/admin/analytics/usage/rollups/status",
+    tags=["Admin", "Analytics"],
+    summary="Get usage rollup backfill status (super admin only)",
+)
+async def admin_get_usage_rollup_status(authorization: str = Header(None)):
+    auth = MagicalAuth(token=authorization)
+    if not auth.is_super_admin():
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied. Super admin role required.",
+        )
+    session = get_session()
+    try:
+        return usage_rollups.get_stats(session)
+    finally:
+        session.close()
+
+
+@app.post(
+    "/v1/admin/analytics/usage/rollups/backfill",
+    tags=["Admin", "Analytics"],
+    summary="Roll up pending token usage records now (super admin only)",
+    description="Runs the resumable usage rollup backfill, optionally stopping after `max_batches` batches.",
+)
+async def admin_backfill_usage_rollups(
+    max_batches: Optional[int] = Query(None, ge=1),
+    authorization: str = Header(None),
+):
+    auth = MagicalAuth(token=authorization)
+    if not auth.is_super_admin():
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied. Super admin role required.",
+        )
+    processed = await asyncio.to_thread(usage_rollups.backfill, max_batches)
+    return {"processed": processed, **usage_rollups.get_stats()}
+
+
+@app.get(
+    "/v1/admin/billing/entitlements/status",
+    tags=["Admin", "Billing"],
+    summary="Get entitlement cache statistics (super admin only)",
+    description="Hit rate, loads, charges and reconcile counts of the cached billing entitlements in this worker.",
+)
+async def admin_get_entitlement_status(authorization: str = Header(None)):
+    auth = MagicalAuth(token=authorization)
+    if not auth.is_super_admin():
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied. Super admin role required.",
+        )
+    return entitlements.get_stats()
+
+
 @app.get(
     "/v1/billing/invoice/{transaction_ref}",
     tags=["Billing"],
@@ -11,7 +11,8 @@ from MagicalAuth import get_user_id, require_scope
 from ApiClient import Agent, verify_api_key, get_api_client, get_agents
 from Conversations import get_or_create_conversation_name_by_id
 from DB import get_session, Conversation, ConversationParticipant, Agent as AgentModel
-from Memories import embed
+from EmbeddingService import ENCODING_FORMATS, embedding_batcher, format_embedding
+from Uploads import receive_upload
 from fastapi import UploadFile, File, Form
 from typing import Optional, List
 from Models import (
@@ -36,6 +37,9 @@ import asyncio
 _RE_QUOTED_MENTION = re.compile(r'@["\u201c]([^"\u201c\u201d"]+)["\u201d]')
 _RE_UNQUOTED_MENTION = re.compile(r"@(\S+)")
 
+# Texts accepted in one /v1/embeddings request, as in OpenAI's API
+EMBEDDING_MAX_INPUTS = 2048
+
 
 def parse_agent_mentions(messages, available_agents):
     """
@@ -581,21 +585,52 @@ async def mcp_chat_completion(
     tags=["Completions"],
     dependencies=[Depends(verify_api_key), Depends(require_scope("agents:execute"))],
     summary="Create Text Embeddings",
-    description="Creates embeddings for the input text. Compatible with OpenAI's embeddings API format.",
+    description="Creates embeddings for the input text or list of texts. Compatible with OpenAI's embeddings API format, including `encoding_format=base64` and `dimensions`. Embeddings come from the server's local embedding model, so `model` is only echoed back.",
+    response_model=EmbeddingResponse,
 )
 async def embedding(
     embedding: EmbeddingModel,
     user=Depends(verify_api_key),
-    authorization: str = Header(None),
 ):
-    ApiClient = get_api_client(authorization=authorization)
-    agent_name = embedding.model
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
-    tokens = get_tokens(embedding.input)
-    embedding = embed(input=embedding.input)
+    # Every agent embeds with the same local model, so no agent is loaded;
+    # concurrent requests are batched into shared off-loop model calls
+    inputs = [embedding.input] if isinstance(embedding.input, str) else embedding.input
+    if not inputs or any(not text for text in inputs):
+        raise HTTPException(
+            status_code=400, detail="input must be a non-empty string or list"
+        )
+    if len(inputs) > EMBEDDING_MAX_INPUTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"input may contain at most {EMBEDDING_MAX_INPUTS} texts",
+        )
+    encoding_format = embedding.encoding_format or "float"
+    if encoding_format not in ENCODING_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"encoding_format must be one of {', '.join(ENCODING_FORMATS)}",
+        )
+    if embedding.dimensions is not None and embedding.dimensions < 1:
+        raise HTTPException(status_code=400, detail="dimensions must be positive")
+    vectors = await embedding_batcher.embed(inputs)
+    if embedding.dimensions and embedding.dimensions > len(vectors[0]):
+        raise HTTPException(
+            status_code=400,
+            detail=f"dimensions must be at most {len(vectors[0])} for this model",
+        )
+    tokens = sum(get_tokens(text) for text in inputs)
     return {
-        "data": [{"embedding": embedding, "index": 0, "object": "embedding"}],
-        "model": agent_name,
+        "data": [
+            {
+                "embedding": format_embedding(
+                    vector, encoding_format, embedding.dimensions
+                ),
+                "index": index,
+                "object": "embedding",
+            }
+            for index, vector in enumerate(vectors)
+        ],
+        "model": embedding.model,
         "object": "list",
         "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
     }
@@ -630,9 +665,8 @@ async def speech_to_text(
     audio_format = file.content_type.split("/")[1]
     if audio_format == "x-wav":
         audio_format = "wav"
-    audio_path = f"./WORKSPACE/{uuid.uuid4().hex}.{audio_format}"
-    with open(audio_path, "wb") as f:
-        f.write(file.file.read())
+    upload = await receive_upload(file)
+    audio_path = await upload.save(f"./WORKSPACE/{uuid.uuid4().hex}.{audio_format}")
     response = await agent.transcribe_audio(
         audio_path=audio_path,
         enable_diarization=enable_diarization,
@@ -691,7 +725,6 @@ async def live_conversation_chunk(
         conversation_name = f"Live Meeting {time.strftime('%Y-%m-%d %H:%M')}"
 
     # Save the audio chunk
-    file_content = file.file.read()
     audio_format = file.content_type.split("/")[1] if file.content_type else "wav"
     if audio_format == "x-wav":
         audio_format = "wav"
@@ -702,8 +735,8 @@ async def live_conversation_chunk(
     audio_path = os.path.normpath(os.path.join(workspace_dir, audio_filename))
     if not audio_path.startswith(workspace_dir + os.sep):
         raise HTTPException(status_code=400, detail="Invalid session or chunk index")
-    with open(audio_path, "wb") as f:
-        f.write(file_content)
+    upload = await receive_upload(file)
+    await upload.save(audio_path)
 
     # Transcribe this chunk with diarization
     agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
@@ -915,9 +948,8 @@ async def translate_audio(
     agent = Agent(agent_name=model, user=user, ApiClient=ApiClient)
     # Save as audio file based on its type
     audio_format = file.content_type.split("/")[1]
-    audio_path = f"./WORKSPACE/{uuid.uuid4().hex}.{audio_format}"
-    with open(audio_path, "wb") as f:
-        f.write(file.file.read())
+    upload = await receive_upload(file)
+    audio_path = await upload.save(f"./WORKSPACE/{uuid.uuid4().hex}.{audio_format}")
     response = await agent.translate_audio(audio_path=audio_path)
     if response.startswith("data:"):
         response = response.split(",")[1]
@@ -1,13 +1,26 @@
 import os
+import json
 import base64
 import asyncio
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Request
+from fastapi.responses import StreamingResponse
 from ApiClient import Agent, verify_api_key, get_api_client, WORKERS, is_admin
-from MagicalAuth import require_scope
+from MagicalAuth import require_scope, get_user_id
 from typing import Dict, Any, List
 from Websearch import Websearch
 from XT import AGiXT
 from Memories import Memories
+from MemoryTransfer import NDJSON_MEDIA_TYPE
+from MemoryLifecycle import POLICY_SETTING, validate_policy_document
+from HybridRetrieval import MemoryFilters
+from DocumentIngestion import ingestion_jobs
+from Uploads import (
+    find_duplicate,
+    forget_upload,
+    is_reserved_upload_name,
+    receive_upload,
+    remember_upload,
+)
 from Conversations import Conversations
 from datetime import datetime
 from Models import (
@@ -23,6 +36,12 @@ from Models import (
     FeedbackInput,
     MemoryResponse,
     MemoryCollectionResponse,
+    MemoryImportResponse,
+    MemoryCompactionResponse,
+    MemoryLifecyclePolicyInput,
+    MemoryLifecycleReportResponse,
+    MemoryLifecycleResponse,
+    IngestionJobResponse,
     DPOResponse,
 )
 import logging
@@ -42,7 +61,7 @@ app = APIRouter()
     dependencies=[Depends(verify_api_key), Depends(require_scope("memories:read"))],
     response_model=MemoryResponse,
     summary="Query agent memories from a specific collection by ID",
-    description="Retrieves memories based on user input with relevance scoring and limiting options using agent ID.",
+    description="Retrieves memories based on user input with relevance scoring and limiting options using agent ID. Full-text and vector matches are fused unless `hybrid` is false, then reranked against the input unless `rerank` is false. `token_budget` caps the total tokens of the returned memories, and results can be filtered by external source and timestamp.",
 )
 async def query_memories_v1(
     agent_id: str,
@@ -66,6 +85,15 @@ async def query_memories_v1(
         user_input=memory.user_input,
         limit=memory.limit,
         min_relevance_score=memory.min_relevance_score,
+        filters=MemoryFilters(
+            external_sources=memory.external_sources,
+            external_source_prefix=memory.external_source_prefix,
+            since=memory.since,
+            until=memory.until,
+        ),
+        hybrid=memory.hybrid,
+        rerank=memory.rerank,
+        token_budget=memory.token_budget,
     )
     return {"memories": memories}
 
@@ -76,21 +104,34 @@ async def query_memories_v1(
     dependencies=[Depends(verify_api_key), Depends(require_scope("memories:read"))],
     response_model=MemoryResponse,
     summary="Export all agent memories by ID",
-    description="Exports all memories from all collections for the specified agent using agent ID.",
+    description="Exports all memories from all collections for the specified agent using agent ID. With `format=ndjson` the export is streamed one memory per line, including embeddings and the embedding model fingerprint, and can be loaded back with the NDJSON import endpoint.",
 )
 async def export_agent_memories_v1(
-    agent_id: str, user=Depends(verify_api_key), authorization: str = Header(None)
+    agent_id: str,
+    format: str = "json",
+    include_embeddings: bool = True,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
 ) -> Dict[str, Any]:
     ApiClient = get_api_client(authorization=authorization)
     agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
     agent_config = agent.get_agent_config()
-    memories = await Memories(
+    memories = Memories(
         agent_name=agent.agent_name,
         agent_config=agent_config,
         ApiClient=ApiClient,
         user=user,
-    ).export_collections_to_json()
-    return {"memories": memories}
+    )
+    if format == "ndjson":
+        filename = f"{agent.agent_name}-memories.ndjson".replace('"', "")
+        return StreamingResponse(
+            memories.export_memories_ndjson(include_embeddings=include_embeddings),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    return {"memories": await memories.export_collections_to_json()}
 
 
 @app.post(
@@ -119,6 +160,35 @@ async def import_agent_memories_v1(
     return ResponseMessage(message="Memories imported.")
 
 
+@app.post(
+    "/v1/agent/{agent_id}/memory/import/ndjson",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=MemoryImportResponse,
+    summary="Stream an NDJSON memory export into agent by ID",
+    description="Imports the request body, an NDJSON memory export, as it streams in. Embeddings are kept when the export's embedding model matches this server's, otherwise the text is re-embedded. Memories from conversations that do not exist for this user are skipped.",
+)
+async def import_agent_memories_ndjson_v1(
+    agent_id: str,
+    request: Request,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> MemoryImportResponse:
+    ApiClient = get_api_client(authorization=authorization)
+    agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
+    agent_config = agent.get_agent_config()
+    try:
+        report = await Memories(
+            agent_name=agent.agent_name,
+            agent_config=agent_config,
+            ApiClient=ApiClient,
+            user=user,
+        ).import_memories_ndjson(request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return MemoryImportResponse(**report)
+
+
 @app.post(
     "/v1/agent/{agent_id}/learn/text",
     tags=["Agent"],
@@ -158,22 +228,9 @@ async def learn_text_v1(
     )
 
 
-@app.post(
-    "/v1/agent/{agent_id}/learn/file",
-    tags=["Agent"],
-    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
-    response_model=ResponseMessage,
-    summary="Learn from file content by ID",
-    description="Processes and adds file content to the agent's memory using agent ID. Supports various file types including PDFs, docs, and spreadsheets.",
-)
-async def learn_file_v1(
-    agent_id: str,
-    file: FileInput,
-    user=Depends(verify_api_key),
-    authorization: str = Header(None),
-) -> ResponseMessage:
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-    collection_number = str(file.collection_number)
+def _learn_file_session(agent_id: str, collection_number, user, authorization: str):
+    """AGiXT session of the agent for learning files into a collection"""
+    collection_number = str(collection_number)
     conversation_name = None
     if len(collection_number) > 4:
         conversation = Conversations(conversation_name=collection_number, user=user)
@@ -183,45 +240,250 @@ async def learn_file_v1(
     # Get agent name from agent_id
     ApiClient = get_api_client(authorization=authorization)
     agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
-    agent_name = agent.agent_name
 
-    agixt_agent = AGiXT(
+    return AGiXT(
         user=user,
-        agent_name=agent_name,
+        agent_name=agent.agent_name,
         api_key=authorization,
         conversation_name=conversation_name,
         collection_id=collection_number,
     )
+
+
+def _learn_file_path(agixt_agent, file: FileInput) -> str:
     file.file_name = os.path.basename(file.file_name)
+    if is_reserved_upload_name(file.file_name):
+        raise HTTPException(
+            status_code=400, detail=f"{file.file_name} is a reserved file name"
+        )
     file_path = os.path.normpath(
         os.path.join(
-            agixt_agent.agent_workspace, file.collection_number, file.file_name
+            agixt_agent.agent_workspace, str(file.collection_number), file.file_name
         )
     )
     if not file_path.startswith(agixt_agent.agent_workspace):
         raise Exception("Path given not allowed")
+    return file_path
+
+
+def _write_learn_file(file_path: str, file_content: str):
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
     try:
-        file_content = base64.b64decode(file.file_content)
+        content = base64.b64decode(file_content)
     except:
-        file_content = file.file_content.encode("utf-8")
+        content = file_content.encode("utf-8")
     with open(file_path, "wb") as f:
-        f.write(file_content)
+        f.write(content)
+
+
+async def _save_learn_file(agent_id: str, file: FileInput, user, authorization: str):
+    """Write an uploaded file to the agent workspace and return its AGiXT session"""
+    agixt_agent = _learn_file_session(
+        agent_id, file.collection_number, user, authorization
+    )
+    file_path = _learn_file_path(agixt_agent, file)
+    # Decoding and writing a large document would stall the event loop
+    await asyncio.to_thread(_write_learn_file, file_path, file.file_content)
+    return agixt_agent
+
+
+async def _receive_learn_upload(
+    agent_id: str,
+    request: Request,
+    file_name: str,
+    collection_number: str,
+    user,
+    authorization: str,
+):
+    """
+    Stream the request body into the agent workspace.
+
+    Returns the AGiXT session, the file, its content hash, and the name of a
+    file in the collection that already has this content (in which case
+    nothing is saved).
+    """
+    agixt_agent = _learn_file_session(agent_id, collection_number, user, authorization)
+    file = FileInput(
+        file_name=file_name, file_content="", collection_number=collection_number
+    )
+    file_path = _learn_file_path(agixt_agent, file)
+    upload = await receive_upload(request, filename=file.file_name)
+    try:
+        directory = os.path.dirname(file_path)
+        duplicate = await find_duplicate(directory, upload.sha256)
+        # Only a duplicate while its memories exist; a wiped collection or a
+        # deleted source has to be learned again
+        if (
+            duplicate is not None
+            and not await agixt_agent.file_reader.has_external_source(
+                f"file {os.path.abspath(os.path.join(directory, duplicate))}"
+            )
+        ):
+            await forget_upload(directory, upload.sha256)
+            duplicate = None
+        if duplicate is None:
+            await upload.save(file_path)
+    finally:
+        upload.close()
+    return agixt_agent, file, upload.sha256, duplicate
+
+
+async def _learn_uploaded_file(
+    agixt_agent, file: FileInput, sha256: str, on_progress=None
+) -> str:
+    response = await _learn_saved_file(agixt_agent, file, on_progress)
+    directory = os.path.join(agixt_agent.agent_workspace, str(file.collection_number))
+    # Recorded once learned, so a failed ingestion can be uploaded again
+    await remember_upload(directory, sha256, file.file_name)
+    return response
+
+
+def _duplicate_message(file: FileInput, duplicate: str) -> str:
+    return (
+        f"File {file.file_name} has the same content as {duplicate}, which was "
+        f"already learned to collection `{file.collection_number}`."
+    )
+
+
+async def _learn_saved_file(agixt_agent, file: FileInput, on_progress=None) -> str:
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    file_url = f"{agixt_agent.outputs}/{file.collection_number}/{file.file_name}"
     response = await agixt_agent.learn_from_file(
-        file_url=f"{agixt_agent.outputs}/{file.collection_number}/{file.file_name}",
+        file_url=file_url,
         file_name=file.file_name,
         user_input=f"File {file.file_name} uploaded on {timestamp}.",
         collection_id=str(file.collection_number),
         save_to_memory=True,
+        on_progress=on_progress,
     )
     agixt_agent.conversation.log_interaction(
-        role=agent_name,
-        message=f"File [{file.file_name}]({agixt_agent.outputs}/{file.collection_number}/{file.file_name}) learned on {timestamp} to collection `{file.collection_number}`.",
+        role=agixt_agent.agent_name,
+        message=f"File [{file.file_name}]({file_url}) learned on {timestamp} to collection `{file.collection_number}`.",
     )
+    return response
+
+
+@app.post(
+    "/v1/agent/{agent_id}/learn/file",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=ResponseMessage,
+    summary="Learn from file content by ID",
+    description="Processes and adds file content to the agent's memory using agent ID. Supports various file types including PDFs, docs, and spreadsheets.",
+)
+async def learn_file_v1(
+    agent_id: str,
+    file: FileInput,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> ResponseMessage:
+    agixt_agent = await _save_learn_file(agent_id, file, user, authorization)
+    response = await _learn_saved_file(agixt_agent, file)
     return ResponseMessage(message=response)
 
 
+@app.post(
+    "/v1/agent/{agent_id}/learn/file/background",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=IngestionJobResponse,
+    summary="Learn from file content in the background by ID",
+    description="Saves the file and returns a job immediately while the file is extracted and added to the agent's memory. Poll GET /v1/ingestion/{job_id} for progress; activity is also logged to the conversation.",
+)
+async def learn_file_background_v1(
+    agent_id: str,
+    file: FileInput,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+):
+    agixt_agent = await _save_learn_file(agent_id, file, user, authorization)
+    return ingestion_jobs.submit(
+        user_id=get_user_id(user=user),
+        file_name=file.file_name,
+        run=lambda on_progress: _learn_saved_file(agixt_agent, file, on_progress),
+        metadata={
+            "agent_id": agent_id,
+            "collection_number": str(file.collection_number),
+        },
+    )
+
+
+@app.post(
+    "/v1/agent/{agent_id}/learn/upload",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=ResponseMessage,
+    summary="Learn from an uploaded file by ID",
+    description="Streams the request body, the raw file, into the agent workspace and adds it to the agent's memory. Unlike /learn/file the content is not base64-encoded in JSON, so large documents are not held in memory. A file whose content was already learned to the collection is not processed again.",
+)
+async def learn_upload_v1(
+    agent_id: str,
+    request: Request,
+    file_name: str,
+    collection_number: str = "0",
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> ResponseMessage:
+    agixt_agent, file, sha256, duplicate = await _receive_learn_upload(
+        agent_id, request, file_name, collection_number, user, authorization
+    )
+    if duplicate:
+        return ResponseMessage(message=_duplicate_message(file, duplicate))
+    response = await _learn_uploaded_file(agixt_agent, file, sha256)
+    return ResponseMessage(message=response)
+
+
+@app.post(
+    "/v1/agent/{agent_id}/learn/upload/background",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=IngestionJobResponse,
+    summary="Learn from an uploaded file in the background by ID",
+    description="Streams the request body, the raw file, into the agent workspace and returns a job immediately while it is extracted and added to the agent's memory. Poll GET /v1/ingestion/{job_id} for progress.",
+)
+async def learn_upload_background_v1(
+    agent_id: str,
+    request: Request,
+    file_name: str,
+    collection_number: str = "0",
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+):
+    agixt_agent, file, sha256, duplicate = await _receive_learn_upload(
+        agent_id, request, file_name, collection_number, user, authorization
+    )
+
+    async def run(on_progress):
+        if duplicate:
+            return _duplicate_message(file, duplicate)
+        return await _learn_uploaded_file(agixt_agent, file, sha256, on_progress)
+
+    return ingestion_jobs.submit(
+        user_id=get_user_id(user=user),
+        file_name=file.file_name,
+        run=run,
+        metadata={
+            "agent_id": agent_id,
+            "collection_number": str(file.collection_number),
+        },
+    )
+
+
+@app.get(
+    "/v1/ingestion/{job_id}",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key)],
+    response_model=IngestionJobResponse,
+    summary="Get a document ingestion job",
+    description="Returns the status, current stage and progress of a background file learning job.",
+)
+async def get_ingestion_job_v1(job_id: str, user=Depends(verify_api_key)):
+    job = ingestion_jobs.get(job_id=job_id, user_id=get_user_id(user=user))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+
 @app.post(
     "/v1/agent/{agent_id}/learn/url",
     tags=["Agent"],
@@ -611,6 +873,118 @@ async def delete_memories_from_external_source_v1(
     )
 
 
+@app.post(
+    "/v1/agent/{agent_id}/memory/compact",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=MemoryCompactionResponse,
+    summary="Compact duplicate memories by ID",
+    description="Merges exact and near-duplicate memories in a collection into the newest copy, recording the other sources on it. Use dry_run to only count what would be removed.",
+)
+async def compact_memories_v1(
+    agent_id: str,
+    collection_number: str = "0",
+    dry_run: bool = False,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> MemoryCompactionResponse:
+    ApiClient = get_api_client(authorization=authorization)
+    agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
+    result = await Memories(
+        agent_name=agent.agent_name,
+        agent_config=agent.AGENT_CONFIG,
+        collection_number=collection_number,
+        ApiClient=ApiClient,
+        user=user,
+    ).compact_memories(dry_run=dry_run)
+    return MemoryCompactionResponse(**result)
+
+
+@app.get(
+    "/v1/agent/{agent_id}/memory/lifecycle",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:read"))],
+    response_model=MemoryLifecycleReportResponse,
+    summary="Report memory collection sizes and lifecycle policy by ID",
+    description="Lists every memory collection of the agent with its row count, approximate size, age, retrieval activity, the lifecycle policy that applies to it, and how many memories the policy would remove now.",
+)
+async def memory_lifecycle_report_v1(
+    agent_id: str,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> MemoryLifecycleReportResponse:
+    ApiClient = get_api_client(authorization=authorization)
+    agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
+    memories = Memories(
+        agent_name=agent.agent_name,
+        agent_config=agent.AGENT_CONFIG,
+        ApiClient=ApiClient,
+        user=user,
+    )
+    try:
+        policy = memories.lifecycle_policy_document()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid lifecycle policy: {e}")
+    return MemoryLifecycleReportResponse(
+        policy=policy, collections=await memories.lifecycle_report()
+    )
+
+
+@app.put(
+    "/v1/agent/{agent_id}/memory/lifecycle",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=ResponseMessage,
+    summary="Set the memory lifecycle policy by ID",
+    description='Sets the agent\'s memory lifecycle policy: TTLs by external source pattern, row and byte caps with least-recently-retrieved eviction, and whether removed memories are archived to workspace storage. Sections are "default", "core", "conversations" and "collections" (keyed by conversation ID).',
+)
+async def set_memory_lifecycle_policy_v1(
+    agent_id: str,
+    body: MemoryLifecyclePolicyInput,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> ResponseMessage:
+    try:
+        validate_policy_document(body.policy)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid lifecycle policy: {e}")
+    ApiClient = get_api_client(authorization=authorization)
+    agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
+    agent.update_agent_config(
+        new_config={POLICY_SETTING: json.dumps(body.policy)}, config_key="settings"
+    )
+    return ResponseMessage(
+        message=f"Memory lifecycle policy for agent {agent.agent_name} updated."
+    )
+
+
+@app.post(
+    "/v1/agent/{agent_id}/memory/lifecycle/enforce",
+    tags=["Agent"],
+    dependencies=[Depends(verify_api_key), Depends(require_scope("memories:write"))],
+    response_model=MemoryLifecycleResponse,
+    summary="Apply the memory lifecycle policy by ID",
+    description="Applies the lifecycle policy to one collection now instead of waiting for the background job. Use dry_run to only count what would be removed.",
+)
+async def enforce_memory_lifecycle_v1(
+    agent_id: str,
+    collection_number: str = "0",
+    dry_run: bool = False,
+    user=Depends(verify_api_key),
+    authorization: str = Header(None),
+) -> MemoryLifecycleResponse:
+    ApiClient = get_api_client(authorization=authorization)
+    agent = Agent(agent_id=agent_id, user=user, ApiClient=ApiClient)
+    result = await Memories(
+        agent_name=agent.agent_name,
+        agent_config=agent.AGENT_CONFIG,
+        collection_number=collection_number,
+        ApiClient=ApiClient,
+        user=user,
+    ).enforce_lifecycle(dry_run=dry_run)
+    return MemoryLifecycleResponse(**result)
+
+
 @app.get(
     "/v1/agent/{agent_id}/memory/external_sources/{collection_number}",
     tags=["Agent"],
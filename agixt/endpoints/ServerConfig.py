@@ -29,6 +29,8 @@ from DB import (
     ServerExtensionSetting,
 )
 from Globals import invalidate_server_config_cache, load_server_config_cache, getenv
+from Entitlements import entitlements
+from BotRuntime import RUNTIME_PLATFORMS, publish_bot_config_change
 import logging
 
 app = APIRouter()
@@ -368,6 +370,7 @@ async def update_server_config_item(
     # Invalidate cache to pick up new value
     invalidate_server_config_cache()
     load_server_config_cache()
+    entitlements.invalidate_settings()
 
     # If EXTENSIONS_HUB was updated, hot-reload extension hubs
     if config_name == "EXTENSIONS_HUB":
@@ -460,6 +463,7 @@ async def bulk_update_server_config(
     # Invalidate cache to pick up new values
     invalidate_server_config_cache()
     load_server_config_cache()
+    entitlements.invalidate_settings()
 
     # If EXTENSIONS_HUB was updated, hot-reload extension hubs
     extension_reload = None
@@ -1366,7 +1370,6 @@ async def enable_company_discord_bot(
     authorization: str = Header(None),
 ):
     """Enable or disable the Discord bot for a company."""
-    from DiscordBotManager import get_discord_bot_manager
     from DB import CompanyExtensionSetting, get_new_id
 
     auth = MagicalAuth(token=authorization)
@@ -1460,18 +1463,13 @@ async def enable_company_discord_bot(
 
         db.commit()
 
-    # Trigger bot sync
-    manager = get_discord_bot_manager()
-    if manager:
-        try:
-            await manager.sync_bots()
-        except Exception as e:
-            logging.error(f"Error syncing Discord bots: {e}")
+    # The bot worker that owns this company applies the change
+    publish_bot_config_change("discord", company_id)
 
     action = "enabled" if request.enabled else "disabled"
     return {
         "status": "success",
-        "message": f"Discord bot {action} for company. Bot will start/stop within 60 seconds.",
+        "message": f"Discord bot {action} for company. Bot will start/stop shortly.",
     }
 
 
@@ -1487,8 +1485,6 @@ async def restart_company_discord_bot(
     authorization: str = Header(None),
 ):
     """Restart the Discord bot for a company."""
-    from DiscordBotManager import get_discord_bot_manager
-
     auth = MagicalAuth(token=authorization)
     auth.validate_user()
 
@@ -1502,17 +1498,13 @@ async def restart_company_discord_bot(
             detail="Access denied. Only company admins or super admins can restart Discord bot.",
         )
 
-    manager = get_discord_bot_manager()
-    if not manager:
+    # The owning bot worker restarts the bot when it applies the change
+    if not publish_bot_config_change("discord", company_id):
         raise HTTPException(
             status_code=503,
             detail="Discord bot manager is not running.",
         )
 
-    # Stop and restart the bot
-    await manager.stop_bot_for_company(company_id)
-    await manager.sync_bots()
-
     return {
         "status": "success",
         "message": "Discord bot restart initiated. Bot will be back online shortly.",
@@ -4018,12 +4010,15 @@ async def enable_company_bot(
                 f"Failed to auto-enable commands for {platform} bot agent {resolved_agent_id}: {e}"
             )
 
-    # Trigger bot sync
+    # Trigger bot sync; sharded managers apply the change from the event
+    publish_bot_config_change(platform, company_id)
     try:
         manager = _get_bot_manager(platform)
-        if manager and hasattr(manager, "sync_bots"):
-            import asyncio
-
+        if (
+            manager
+            and hasattr(manager, "sync_bots")
+            and getattr(manager, "runtime", None) is None
+        ):
             asyncio.create_task(manager.sync_bots())
     except Exception as e:
         logging.error(f"Error syncing {platform} bots: {e}")
@@ -4031,7 +4026,7 @@ async def enable_company_bot(
     action = "enabled" if request.enabled else "disabled"
     return {
         "status": "success",
-        "message": f"{platform.title()} bot {action} for company. Bot will start/stop within 60 seconds.",
+        "message": f"{platform.title()} bot {action} for company. Bot will start/stop shortly.",
         "instance_id": instance_id,
     }
 
@@ -4069,6 +4064,17 @@ async def restart_company_bot(
             detail="Access denied. Only company admins can restart bots.",
         )
 
+    # Sharded bot workers restart the bot when they apply the change. The
+    # subscriber count covers the whole channel, so it only says a runtime is
+    # listening for platforms that have one.
+    if platform in RUNTIME_PLATFORMS and publish_bot_config_change(
+        platform, company_id
+    ):
+        return {
+            "status": "success",
+            "message": f"{platform.title()} bot restart initiated. Bot will be back online shortly.",
+        }
+
     manager = _get_bot_manager(platform)
     if not manager:
         raise HTTPException(
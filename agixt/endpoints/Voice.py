@@ -13,6 +13,7 @@ from Conversations import (
     get_conversation_id_by_name,
 )
 from MagicalAuth import MagicalAuth
+from SpeechStream import parse_sample_rate
 from VoiceConversation import VoiceConversationSession, VoiceState
 
 app = APIRouter()
@@ -33,9 +34,12 @@ async def voice_conversation(
     - Thinker (35B): Full AGiXT pipeline processing
 
     Client -> Server messages:
-    - Binary frames: Raw audio data (WAV/PCM)
+    - Binary frames: Raw audio data (WAV/PCM). In streaming input mode, raw
+      16-bit mono PCM that is transcribed as it arrives; the server detects
+      the end of each utterance itself
     - JSON text frames:
         {"type": "audio.input.end"} - Audio input complete, begin processing
+            (in streaming input mode: end the current utterance now)
         {"type": "text.input", "text": "..."} - Text input (typed)
         {"type": "image.input", "data": "<base64 jpeg>"} - Camera frame for vision context
         {"type": "interrupt"} - Barge-in / stop speaking
@@ -43,6 +47,8 @@ async def voice_conversation(
             Optional fields: voice, language, agent, audio_format
             audio_format can be "pcm" (raw 24kHz 16-bit mono), "pcm_framed"
             (upstream length-prefixed PCM), or "wav" (complete WAV blobs).
+            input_mode "stream" (with optional input_sample_rate, default
+            16000) switches audio input to streaming transcription.
         {"type": "tools.register", "tools": [...]} - Register client-side tools
             Each tool: {"type": "function", "function": {"name": "...", "description": "...", "parameters": {...}}}
         {"type": "tool.result", "request_id": "...", "result": "..."} - Tool execution result
@@ -55,6 +61,10 @@ async def voice_conversation(
         {"type": "audio.end", "data": {}} - Audio playback complete
         {"type": "audio.interrupt", "data": {}} - Stop playing audio
         {"type": "transcript.user", "data": {"text": "..."}} - User speech transcript
+        {"type": "transcript.partial", "data": {"text": "...", "stable": bool}}
+            - Hypothesis while the user is speaking (streaming input mode)
+        {"type": "speech.start", "data": {}} / {"type": "speech.end", "data": {}}
+            - Utterance boundaries detected by the server (streaming input mode)
         {"type": "transcript.agent", "data": {"text": "...", "role": "speaker|thinker"}}
         {"type": "tool.request", "data": {"request_id": "...", "tool_name": "...", "tool_args": {...}}}
         {"type": "session.end", "data": {"reason": "user_goodbye"}} - Session ending
@@ -160,6 +170,40 @@ async def voice_conversation(
         max_audio_buffer = 10 * 1024 * 1024  # 10MB max (~5 minutes of 16kHz mono)
         processing_task = None
 
+        async def route_input(handle, handle_mid, payload):
+            """Start a new turn, or steer the thinker if it is working."""
+            nonlocal processing_task
+            # If thinker is working, route to mid-conversation
+            # handler (injects steering instead of canceling)
+            if (
+                processing_task
+                and not processing_task.done()
+                and session.state
+                in (
+                    VoiceState.WORKING,
+                    VoiceState.NARRATING,
+                )
+            ):
+                asyncio.ensure_future(handle_mid(payload))
+                return
+            # Cancel any existing processing
+            if processing_task and not processing_task.done():
+                await session.handle_interrupt()
+                processing_task.cancel()
+                try:
+                    await processing_task
+                except asyncio.CancelledError:
+                    pass
+
+            processing_task = asyncio.ensure_future(handle(payload))
+
+        async def route_transcript(text):
+            await route_input(
+                session.handle_user_transcript,
+                session.handle_mid_conversation_text,
+                text,
+            )
+
         # Main message loop
         while True:
             try:
@@ -172,6 +216,9 @@ async def voice_conversation(
 
             # Binary frame = audio data
             if "bytes" in message and message["bytes"]:
+                if session.streaming_input:
+                    await session.handle_audio_frame(message["bytes"])
+                    continue
                 if len(audio_buffer) + len(message["bytes"]) > max_audio_buffer:
                     logging.warning(
                         f"[VoiceConversation WS] Audio buffer overflow "
@@ -199,74 +246,40 @@ async def voice_conversation(
                 msg_type = msg.get("type", "")
 
                 if msg_type == "audio.input.end":
+                    if session.streaming_input:
+                        await session.end_audio_input()
                     # Process accumulated audio
-                    if audio_buffer:
+                    elif audio_buffer:
                         audio_data = bytes(audio_buffer)
                         audio_buffer.clear()
-
-                        # If thinker is working, route to mid-conversation
-                        # handler (injects steering instead of canceling)
-                        if (
-                            processing_task
-                            and not processing_task.done()
-                            and session.state
-                            in (
-                                VoiceState.WORKING,
-                                VoiceState.NARRATING,
-                            )
-                        ):
-                            asyncio.ensure_future(
-                                session.handle_mid_conversation_audio(audio_data)
-                            )
-                        else:
-                            # Cancel any existing processing
-                            if processing_task and not processing_task.done():
-                                await session.handle_interrupt()
-                                processing_task.cancel()
-                                try:
-                                    await processing_task
-                                except asyncio.CancelledError:
-                                    pass
-
-                            processing_task = asyncio.ensure_future(
-                                session.handle_user_audio(audio_data)
-                            )
+                        await route_input(
+                            session.handle_user_audio,
+                            session.handle_mid_conversation_audio,
+                            audio_data,
+                        )
 
                 elif msg_type == "text.input":
                     text = msg.get("text", "").strip()
                     if text:
-                        # If thinker is working, route to mid-conversation
-                        # handler (injects steering instead of canceling)
-                        if (
-                            processing_task
-                            and not processing_task.done()
-                            and session.state
-                            in (
-                                VoiceState.WORKING,
-                                VoiceState.NARRATING,
-                            )
-                        ):
-                            asyncio.ensure_future(
-                                session.handle_mid_conversation_text(text)
-                            )
-                        else:
-                            # Cancel any existing processing
-                            if processing_task and not processing_task.done():
-                                await session.handle_interrupt()
-                                processing_task.cancel()
-                                try:
-                                    await processing_task
-                                except asyncio.CancelledError:
-                                    pass
-
-                            processing_task = asyncio.ensure_future(
-                                session.handle_user_text(text)
-                            )
+                        await route_input(
+                            session.handle_user_text,
+                            session.handle_mid_conversation_text,
+                            text,
+                        )
 
                 elif msg_type == "interrupt":
                     await session.handle_interrupt()
 
                 elif msg_type == "config":
+                    try:
+                        input_sample_rate = parse_sample_rate(
+                            msg.get("input_sample_rate")
+                        )
+                    except ValueError as e:
+                        await websocket.send_text(
+                            json.dumps({"type": "error", "data": {"message": str(e)}})
+                        )
+                        continue
                     if "voice" in msg:
                         session.tts_voice = msg["voice"]
                     if "language" in msg:
@@ -275,6 +288,10 @@ async def voice_conversation(
                         session.tts_audio_format = session._normalize_audio_format(
                             msg["audio_format"]
                         )
+                    if msg.get("input_mode") == "stream":
+                        session.start_streaming_input(
+                            route_transcript, sample_rate=input_sample_rate
+                        )
                     if "agent" in msg:
                         session.agent_name = msg["agent"]
                         session.agent = Agent(
@@ -290,6 +307,11 @@ async def voice_conversation(
                                     "state": "idle",
                                     "message": "Configuration updated",
                                     "audio_format": session.tts_audio_format,
+                                    "input_mode": (
+                                        "stream"
+                                        if session.streaming_input
+                                        else "buffered"
+                                    ),
                                 },
                             }
                         )
@@ -261,7 +261,7 @@ class automation_helpers(Extensions):
         fields = output_model.model_fields
         field_descriptions = [f"{field}: {fields[field]}" for field in fields]
         schema = "\n".join(field_descriptions)
-        response = self.ApiClient.prompt_agent(
+        response = await self.ApiClient.prompt_agent_async(
             agent_id=self.agent_id,
             prompt_name="Convert to JSON",
             prompt_args={
@@ -490,7 +490,7 @@ class automation_helpers(Extensions):
 }
 ```
 """
-            response = self.ApiClient.prompt_agent(
+            response = await self.ApiClient.prompt_agent_async(
                 agent_id=self.agent_id,
                 prompt_name="Think About It",
                 prompt_args={
@@ -582,18 +582,19 @@ class automation_helpers(Extensions):
         Use MCP (Model Context Protocol) Server
 
         Args:
-        mcp_server (str): The MCP server name or URI
+        mcp_server (str): The configured MCP server name or an http(s) URL
         method (str): The MCP method to call
         params (dict): Parameters for the MCP method
 
         Returns:
         str: The response from the MCP server
         """
+        if not isinstance(mcp_server, str):
+            return "Error using MCP server: the server must be a configured name or URL"
         try:
-            from mcp_client import MCPClient
+            from mcp_client import mcp_sessions
 
-            client = MCPClient()
-            response = await client.call_method(
+            response = await mcp_sessions.call_method(
                 server=mcp_server, method=method, params=params
             )
             return str(response)
@@ -21,6 +21,8 @@ from safeexecute import execute_python_code
 from InternalClient import InternalClient
 from Globals import getenv
 from Task import Task
+from CodeIndex import get_code_index
+from SemanticCodeIndex import get_semantic_code_index
 from middleware import log_silenced_exception
 from DB import (
     get_session,
@@ -648,9 +650,11 @@ find /workspace -xdev -type f -uid {uid} -exec chmod u+rw {{}} + 2>/dev/null ||
                 f.write(content)
 
         self._run_with_permission_repair(write_file)
+        get_code_index(self.WORKING_DIRECTORY).notify_changed(filepath)
 
     def _remove_file(self, filepath: str) -> None:
         self._run_with_permission_repair(lambda: os.remove(filepath))
+        get_code_index(self.WORKING_DIRECTORY).notify_deleted(filepath)
 
     @staticmethod
     def we_are_running_in_a_docker_container() -> bool:
@@ -1055,92 +1059,31 @@ find /workspace -xdev -type f -uid {uid} -exec chmod u+rw {{}} + 2>/dev/null ||
 
         Note: Searches all text-based files. For binary files, use other tools.
         """
-        # Binary file extensions to skip
-        BINARY_EXTENSIONS = {
-            ".jpg",
-            ".jpeg",
-            ".png",
-            ".gif",
-            ".bmp",
-            ".ico",
-            ".webp",
-            ".svg",
-            ".mp3",
-            ".mp4",
-            ".wav",
-            ".avi",
-            ".mov",
-            ".mkv",
-            ".flac",
-            ".zip",
-            ".tar",
-            ".gz",
-            ".rar",
-            ".7z",
-            ".pdf",
-            ".doc",
-            ".docx",
-            ".xls",
-            ".xlsx",
-            ".ppt",
-            ".pptx",
-            ".exe",
-            ".dll",
-            ".so",
-            ".dylib",
-            ".bin",
-            ".pyc",
-            ".pyo",
-            ".class",
-            ".o",
-            ".obj",
-            ".db",
-            ".sqlite",
-            ".sqlite3",
-        }
-
         matches = []
         try:
-            if filename:
-                # Check if it's a directory path
-                check_path = self.safe_join(filename.rstrip("/"))
-                if os.path.isdir(check_path):
-                    # Search in all files within this directory
-                    files_to_search = []
-                    for root, dirs, files in os.walk(check_path):
-                        for file in files:
-                            ext = os.path.splitext(file)[1].lower()
-                            if ext not in BINARY_EXTENSIONS:
-                                relative_path = os.path.relpath(
-                                    os.path.join(root, file), self.WORKING_DIRECTORY
-                                )
-                                files_to_search.append(relative_path)
-                else:
-                    # Search in specific file
-                    files_to_search = [filename]
-            else:
-                # Search in all text-based files
-                files_to_search = []
-                for root, dirs, files in os.walk(self.WORKING_DIRECTORY):
-                    for file in files:
-                        ext = os.path.splitext(file)[1].lower()
-                        if ext not in BINARY_EXTENSIONS:
-                            relative_path = os.path.relpath(
-                                os.path.join(root, file), self.WORKING_DIRECTORY
-                            )
-                            files_to_search.append(relative_path)
-
-            for file_path in files_to_search:
+            index = get_code_index(self.WORKING_DIRECTORY)
+            if filename and not os.path.isdir(self.safe_join(filename.rstrip("/"))):
+                # Search in specific file
                 try:
-                    full_path = self.safe_join(file_path)
+                    full_path = self.safe_join(filename)
                     with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
                         lines = f.readlines()
-
                     for line_num, line in enumerate(lines, 1):
                         if query.lower() in line.lower():
-                            matches.append(f"{file_path}:{line_num}: {line.strip()}")
-                except:
-                    continue
+                            matches.append(f"{filename}:{line_num}: {line.strip()}")
+                except Exception:
+                    pass
+            else:
+                # Search all indexed text files, optionally within a folder
+                prefix = ""
+                if filename:
+                    prefix = os.path.relpath(
+                        self.safe_join(filename.rstrip("/")), index.root
+                    ).replace(os.sep, "/")
+                    if prefix == ".":
+                        prefix = ""
+                for rel_path, line_num, line in index.search(query, prefix=prefix):
+                    matches.append(f"{rel_path}:{line_num}: {line.strip()}")
 
             if matches:
                 result = f"Found {len(matches)} matches for '{query}':\n\n"
@@ -1253,88 +1196,41 @@ find /workspace -xdev -type f -uid {uid} -exec chmod u+rw {{}} + 2>/dev/null ||
         - query="power|off|on", is_regex=True - Find power, off, or on using regex alternation
         - query="def ", pattern="**/*.py", context_lines=2 - Find function definitions with 2 lines context
         """
-        import fnmatch
         import re
 
         try:
             if is_regex:
                 try:
-                    search_pattern = re.compile(query, re.IGNORECASE)
+                    re.compile(query, re.IGNORECASE)
                 except re.error as e:
                     return f"Invalid regex pattern: {e}"
-            else:
-                search_pattern = None
 
             matches = []
-            files_searched = 0
-
-            for root, dirs, files in os.walk(self.WORKING_DIRECTORY):
-                for filename in files:
-                    # Check if file matches the glob pattern
-                    rel_root = os.path.relpath(root, self.WORKING_DIRECTORY)
-                    if rel_root == ".":
-                        rel_path = filename
-                    else:
-                        rel_path = f"{rel_root}/{filename}"
-
-                    # Match file against pattern
-                    if not fnmatch.fnmatch(rel_path, pattern) and not fnmatch.fnmatch(
-                        filename, pattern.split("/")[-1] if "/" in pattern else pattern
-                    ):
-                        continue
-
-                    # Skip binary files
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in BINARY_EXTENSIONS:
-                        continue
-
-                    file_path = os.path.join(root, filename)
-                    try:
-                        with open(
-                            file_path, "r", encoding="utf-8", errors="ignore"
-                        ) as f:
-                            lines = f.readlines()
-
-                        for line_num, line in enumerate(lines, 1):
-                            # Check for match
-                            if is_regex:
-                                if search_pattern.search(line):
-                                    found = True
-                                else:
-                                    found = False
-                            else:
-                                found = query.lower() in line.lower()
-
-                            if found:
-                                if context_lines > 0:
-                                    # Include context
-                                    start = max(0, line_num - 1 - context_lines)
-                                    end = min(len(lines), line_num + context_lines)
-                                    context = []
-                                    for i in range(start, end):
-                                        prefix = ">" if i == line_num - 1 else " "
-                                        context.append(
-                                            f"  {prefix} {i+1}: {lines[i].rstrip()}"
-                                        )
-                                    matches.append(
-                                        f"{rel_path}:\n" + "\n".join(context)
-                                    )
-                                else:
-                                    matches.append(
-                                        f"{rel_path}:{line_num}: {line.strip()}"
-                                    )
-
-                                if len(matches) >= max_results:
-                                    break
+            files_searched = set()
+            index = get_code_index(self.WORKING_DIRECTORY)
 
-                        files_searched += 1
-                    except:
-                        continue
+            # The index narrows the search to files that can contain the query
+            # (trigram filter) and serves their lines from memory.
+            for rel_path, line_num, line in index.search(
+                query, pattern=pattern, is_regex=is_regex
+            ):
+                files_searched.add(rel_path)
+                if context_lines > 0:
+                    # Include context
+                    lines = index.get_lines(rel_path)
+                    start = max(0, line_num - 1 - context_lines)
+                    end = min(len(lines), line_num + context_lines)
+                    context = []
+                    for i in range(start, end):
+                        prefix = ">" if i == line_num - 1 else " "
+                        context.append(f"  {prefix} {i+1}: {lines[i].rstrip()}")
+                    matches.append(f"{rel_path}:\n" + "\n".join(context))
+                else:
+                    matches.append(f"{rel_path}:{line_num}: {line.strip()}")
 
-                    if len(matches) >= max_results:
-                        break
                 if len(matches) >= max_results:
                     break
+            files_searched = len(files_searched)
 
             if matches:
                 result = f"Found {len(matches)} matches for '{query}' in {files_searched} files:\n\n"
@@ -1581,7 +1477,7 @@ print(output)
         Returns:
         str: The result of the data analysis
         """
-        return self.ApiClient.prompt_agent(
+        return await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -1609,7 +1505,7 @@ print(output)
         Returns:
         str: The response from the helper agent
         """
-        return self.ApiClient.prompt_agent(
+        return await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -1888,7 +1784,7 @@ print(output)
         Returns:
         str: The name of the created chain
         """
-        response = self.ApiClient.prompt_agent(
+        response = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Create Chain",
             prompt_args={
@@ -1909,7 +1805,7 @@ print(output)
         Returns:
         str: Confirmation of the modifications
         """
-        response = self.ApiClient.prompt_agent(
+        response = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Modify Chain",
             prompt_args={
@@ -2099,7 +1995,7 @@ print(output)
         Returns:
         dict: The mindmap
         """
-        mindmap = self.ApiClient.prompt_agent(
+        mindmap = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -4192,7 +4088,7 @@ Example response format: Write to File, Read File, Execute Python Code, Search F
 The assistant's full response should be in the answer block."""
 
             try:
-                command_selection_response = self.ApiClient.prompt_agent(
+                command_selection_response = await self.ApiClient.prompt_agent_async(
                     agent_name=self.agent_name,
                     prompt_name="Think About It",
                     prompt_args={
@@ -4278,7 +4174,7 @@ Make this detailed, actionable, and specific to the agent's role. Use clear form
 The assistant's full response should be in the answer block."""
 
             try:
-                enhanced_context_response = self.ApiClient.prompt_agent(
+                enhanced_context_response = await self.ApiClient.prompt_agent_async(
                     agent_name=self.agent_name,
                     prompt_name="Think About It",
                     prompt_args={
@@ -4356,7 +4252,7 @@ The assistant's full response should be in the answer block."""
 
                 for url in url_list:
                     try:
-                        self.ApiClient.learn_url(
+                        await self.ApiClient.learn_url_async(
                             agent_name=agent_name, url=url, collection_number="0"
                         )
                         training_summary.append(f"✓ Trained with URL: {url}")
@@ -4393,7 +4289,7 @@ Example format: "When to ask MarketingExpert: Consult for SEO optimization, cont
 Your response (just the sentence in the answer block):"""
 
             try:
-                when_to_ask_response = self.ApiClient.prompt_agent(
+                when_to_ask_response = await self.ApiClient.prompt_agent_async(
                     agent_name=self.agent_name,
                     prompt_name="Think About It",
                     prompt_args={
@@ -4708,7 +4604,6 @@ On the sidebar, expanding `Automation` reveals the following pages:
             - Find all uses of a class: symbol_name="UserModel"
             - Find variable references: symbol_name="config_settings"
         """
-        import fnmatch
         import re
 
         try:
@@ -4735,74 +4630,48 @@ On the sidebar, expanding `Automation` reveals the following pages:
             ]
             definition_regex = re.compile("|".join(definition_patterns))
 
-            for root, dirs, files in os.walk(self.WORKING_DIRECTORY):
-                # Skip hidden directories and common non-code directories
-                dirs[:] = [
-                    d
-                    for d in dirs
-                    if not d.startswith(".")
-                    and d
-                    not in [
-                        "node_modules",
-                        "__pycache__",
-                        "venv",
-                        ".venv",
-                        "dist",
-                        "build",
-                    ]
-                ]
-
-                for filename in files:
-                    rel_root = os.path.relpath(root, self.WORKING_DIRECTORY)
-                    if rel_root == ".":
-                        rel_path = filename
-                    else:
-                        rel_path = f"{rel_root}/{filename}"
-
-                    # Check if file matches pattern
-                    if not fnmatch.fnmatch(
-                        rel_path, file_patterns
-                    ) and not fnmatch.fnmatch(
-                        filename,
-                        (
-                            file_patterns.split("/")[-1]
-                            if "/" in file_patterns
-                            else file_patterns
-                        ),
-                    ):
-                        continue
-
-                    # Skip binary files
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in BINARY_EXTENSIONS:
-                        continue
-
-                    file_path = os.path.join(root, filename)
-                    try:
-                        with open(
-                            file_path, "r", encoding="utf-8", errors="ignore"
-                        ) as f:
-                            lines = f.readlines()
-
-                        for line_num, line in enumerate(lines, 1):
-                            if pattern.search(line):
-                                is_definition = bool(definition_regex.search(line))
+            skip_dirs = {
+                "node_modules",
+                "__pycache__",
+                "venv",
+                ".venv",
+                "dist",
+                "build",
+            }
+            index = get_code_index(self.WORKING_DIRECTORY)
+            # Definition sites known to the symbol table (covers languages the
+            # line patterns above do not, e.g. Go funcs and Rust fns)
+            indexed_definitions = {
+                (rel_path, line_num)
+                for rel_path, line_num, _ in index.find_definitions(symbol_name)
+            }
+            searched = set()
 
-                                entry = {
-                                    "file": rel_path,
-                                    "line": line_num,
-                                    "content": line.strip(),
-                                    "type": "definition" if is_definition else "usage",
-                                }
+            for rel_path, line_num, line in index.search(
+                symbol_name, pattern=file_patterns, refresh=False
+            ):
+                # Skip hidden directories and common non-code directories
+                directories = rel_path.split("/")[:-1]
+                if any(d.startswith(".") or d in skip_dirs for d in directories):
+                    continue
+                searched.add(rel_path)
+                if pattern.search(line):
+                    is_definition = bool(definition_regex.search(line)) or (
+                        (rel_path, line_num) in indexed_definitions
+                    )
 
-                                if is_definition:
-                                    definitions.append(entry)
-                                else:
-                                    usages.append(entry)
+                    entry = {
+                        "file": rel_path,
+                        "line": line_num,
+                        "content": line.strip(),
+                        "type": "definition" if is_definition else "usage",
+                    }
 
-                        files_searched += 1
-                    except Exception:
-                        continue
+                    if is_definition:
+                        definitions.append(entry)
+                    else:
+                        usages.append(entry)
+            files_searched = len(searched)
 
             # Build result
             result = f"# Symbol Analysis: `{symbol_name}`\n\n"
@@ -4855,172 +4724,44 @@ On the sidebar, expanding `Automation` reveals the following pages:
             - "API endpoint definitions"
             - "configuration loading"
         """
-        import fnmatch
-        import re
-
         try:
-            # Build search terms from the query
-            # Extract key terms and common programming synonyms
-            query_lower = query.lower()
-            search_terms = []
-
-            # Add original query words
-            words = re.findall(r"\b\w+\b", query_lower)
-            search_terms.extend(words)
-
-            # Add programming-specific synonyms
-            synonyms = {
-                "auth": [
-                    "authenticate",
-                    "authentication",
-                    "login",
-                    "logout",
-                    "session",
-                    "token",
-                    "jwt",
-                    "oauth",
-                ],
-                "database": [
-                    "db",
-                    "sql",
-                    "query",
-                    "connection",
-                    "cursor",
-                    "orm",
-                    "model",
-                ],
-                "error": [
-                    "exception",
-                    "try",
-                    "except",
-                    "catch",
-                    "raise",
-                    "throw",
-                    "error",
-                ],
-                "config": [
-                    "configuration",
-                    "settings",
-                    "env",
-                    "environment",
-                    "options",
-                ],
-                "api": ["endpoint", "route", "request", "response", "rest", "http"],
-                "test": ["unittest", "pytest", "assert", "mock", "fixture"],
-                "log": ["logging", "logger", "debug", "info", "warning", "error"],
-                "file": ["read", "write", "open", "path", "directory", "folder"],
-                "user": ["account", "profile", "member", "customer"],
-                "data": ["parse", "serialize", "json", "xml", "csv"],
-            }
-
-            for word in words:
-                for key, values in synonyms.items():
-                    if word == key or word in values:
-                        search_terms.extend(values)
-                        search_terms.append(key)
-
-            search_terms = list(set(search_terms))
-
-            # Score-based matching
-            results = []
-            files_searched = 0
-
-            for root, dirs, files in os.walk(self.WORKING_DIRECTORY):
-                dirs[:] = [
-                    d
-                    for d in dirs
-                    if not d.startswith(".")
-                    and d
-                    not in [
-                        "node_modules",
-                        "__pycache__",
-                        "venv",
-                        ".venv",
-                        "dist",
-                        "build",
-                    ]
-                ]
-
-                for filename in files:
-                    rel_root = os.path.relpath(root, self.WORKING_DIRECTORY)
-                    if rel_root == ".":
-                        rel_path = filename
-                    else:
-                        rel_path = f"{rel_root}/{filename}"
-
-                    if not fnmatch.fnmatch(
-                        rel_path, file_patterns
-                    ) and not fnmatch.fnmatch(
-                        filename,
-                        (
-                            file_patterns.split("/")[-1]
-                            if "/" in file_patterns
-                            else file_patterns
-                        ),
-                    ):
-                        continue
-
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in BINARY_EXTENSIONS:
-                        continue
-
-                    file_path = os.path.join(root, filename)
-                    try:
-                        with open(
-                            file_path, "r", encoding="utf-8", errors="ignore"
-                        ) as f:
-                            content = f.read()
-                            lines = content.split("\n")
-
-                        # Score the file based on term matches
-                        content_lower = content.lower()
-                        file_score = sum(
-                            content_lower.count(term) for term in search_terms
-                        )
-
-                        if file_score > 0:
-                            # Find the most relevant lines
-                            line_scores = []
-                            for i, line in enumerate(lines):
-                                line_lower = line.lower()
-                                line_score = sum(
-                                    1 for term in search_terms if term in line_lower
-                                )
-                                if line_score > 0:
-                                    line_scores.append(
-                                        (i + 1, line_score, line.strip())
-                                    )
-
-                            # Sort by score and take top matches
-                            line_scores.sort(key=lambda x: x[1], reverse=True)
-                            top_lines = line_scores[:5]
-
-                            results.append(
-                                {
-                                    "file": rel_path,
-                                    "score": file_score,
-                                    "matches": top_lines,
-                                }
-                            )
-
-                        files_searched += 1
-                    except Exception:
-                        continue
-
-            # Sort by score
-            results.sort(key=lambda x: x["score"], reverse=True)
-            results = results[:max_results]
+            index = get_semantic_code_index(self.WORKING_DIRECTORY)
+            # Chunking and embedding are CPU bound; keep them off the event loop
+            hits = await asyncio.to_thread(
+                index.search,
+                query,
+                file_patterns=file_patterns,
+                max_results=int(max_results),
+            )
+            stats = index.get_stats()
 
             # Build output
             output = f'# Semantic Search: "{query}"\n\n'
-            output += f"Searched {files_searched} files, found {len(results)} relevant files\n"
-            output += f"Search terms used: {', '.join(search_terms[:15])}{'...' if len(search_terms) > 15 else ''}\n\n"
-
-            if results:
-                for r in results:
-                    output += f"## {r['file']} (relevance: {r['score']})\n"
-                    for line_num, score, content in r["matches"]:
-                        output += f"  - Line {line_num}: `{content[:80]}{'...' if len(content) > 80 else ''}`\n"
+            output += (
+                f"Searched {stats['chunks']} code chunks in {stats['files']} files, "
+                f"found {len(hits)} relevant sections\n"
+            )
+            if stats["embedding_error"]:
+                output += "(Embeddings unavailable, ranked by keyword relevance only)\n"
+            output += "\n"
+
+            if hits:
+                for hit in hits:
+                    chunk = hit.chunk
+                    label = f" `{chunk.name}`" if chunk.name else ""
+                    output += (
+                        f"## {chunk.rel_path}:{chunk.start_line}-{chunk.end_line}"
+                        f"{label} (relevance: {hit.score:.2f})\n"
+                    )
+                    preview = [
+                        text_line.strip()
+                        for text_line in chunk.text.split("\n")
+                        if text_line.strip()
+                    ]
+                    for line in preview[:5]:
+                        output += (
+                            f"  - `{line[:80]}{'...' if len(line) > 80 else ''}`\n"
+                        )
                     output += "\n"
             else:
                 output += "No relevant code found for your query.\n"
@@ -10122,11 +9863,13 @@ On the sidebar, expanding `Automation` reveals the following pages:
                         continue
 
                     try:
-                        with open(
-                            full_path, "r", encoding="utf-8", errors="ignore"
-                        ) as f:
-                            content = f.read()
-                        tokens = get_tokens(content)
+                        # Served from the workspace code index, which caches
+                        # contents and token counts until the file changes
+                        index_path = os.path.relpath(
+                            os.path.realpath(full_path), index.root
+                        ).replace(os.sep, "/")
+                        content = index.get_text(index_path)
+                        tokens = index.get_tokens(index_path, get_tokens)
 
                         files.append(
                             {
@@ -10167,6 +9910,8 @@ On the sidebar, expanding `Automation` reveals the following pages:
 
             # Parse .gitignore from workspace root
             gitignore_patterns = parse_gitignore(self.WORKING_DIRECTORY)
+            index = get_code_index(self.WORKING_DIRECTORY)
+            index.refresh()
 
             # If updating based on a single file
             if update_file:
@@ -10230,7 +9975,7 @@ Analyze this file and update the codebase map accordingly. You must:
 Provide the COMPLETE updated codebase map in Markdown format.
 Do not summarize or abbreviate - output the full document with your updates integrated."""
 
-                update_response = self.ApiClient.prompt_agent(
+                update_response = await self.ApiClient.prompt_agent_async(
                     agent_id=self.agent_id,
                     prompt_name="Think About It",
                     prompt_args={
@@ -10354,7 +10099,7 @@ Format your response as structured Markdown:
 - Use code blocks for important function signatures
 - Be thorough but concise"""
 
-                chunk_response = self.ApiClient.prompt_agent(
+                chunk_response = await self.ApiClient.prompt_agent_async(
                     agent_id=self.agent_id,
                     prompt_name="Think About It",
                     prompt_args={
@@ -10492,7 +10237,7 @@ Quick reference for common tasks:
 - Be comprehensive but not verbose
 - Focus on being useful for developers new to the codebase"""
 
-            final_map = self.ApiClient.prompt_agent(
+            final_map = await self.ApiClient.prompt_agent_async(
                 agent_id=self.agent_id,
                 prompt_name="Think About It",
                 prompt_args={
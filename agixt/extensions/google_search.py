@@ -34,7 +34,7 @@ class google_search(Extensions):
             websearch_depth = int(websearch_depth)
         except ValueError:
             websearch_depth = 2
-        return self.ApiClient.prompt_agent(
+        return await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
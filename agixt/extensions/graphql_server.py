@@ -198,7 +198,7 @@ class graphql_server(Extensions):
 
         # Generate GraphQL query based on the schema and natural language query
         date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        graphql_query = self.ApiClient.prompt_agent(
+        graphql_query = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -524,7 +524,7 @@ For each component:
 
 Format as a structured bill of materials (BOM) clearly marking inventory vs purchase items."""
 
-        return self.ApiClient.prompt_agent(
+        return await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -616,7 +616,7 @@ Provide comprehensive circuit design documentation including:
 
 Format everything clearly with proper sections and include any important notes or warnings."""
 
-        circuit_design = self.ApiClient.prompt_agent(
+        circuit_design = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -774,7 +774,7 @@ Instructions:
 
 Return ONLY the complete, fixed Arduino code in a code block."""
 
-            response = self.ApiClient.prompt_agent(
+            response = await self.ApiClient.prompt_agent_async(
                 agent_name=self.agent_name,
                 prompt_name="Think About It",
                 prompt_args={
@@ -918,7 +918,7 @@ For each identified part, provide:
 
 Create a comprehensive list prioritized by importance, focusing on parts that are essential for the project to function properly. Include brief descriptions of the design requirements for each part."""
 
-            parts_analysis = self.ApiClient.prompt_agent(
+            parts_analysis = await self.ApiClient.prompt_agent_async(
                 agent_name=self.agent_name,
                 prompt_name="Think About It",
                 prompt_args={
@@ -947,7 +947,7 @@ Return only the part names, one per line, starting with the most critical parts
 - Display Bezel
 - etc."""
 
-            parts_list_response = self.ApiClient.prompt_agent(
+            parts_list_response = await self.ApiClient.prompt_agent_async(
                 agent_name=self.agent_name,
                 prompt_name="Think About It",
                 prompt_args={
@@ -1067,7 +1067,7 @@ Provide step-by-step assembly instructions that cover:
 
 Make it clear and detailed enough for someone to follow without prior experience."""
 
-            assembly_instructions = self.ApiClient.prompt_agent(
+            assembly_instructions = await self.ApiClient.prompt_agent_async(
                 agent_name=self.agent_name,
                 prompt_name="Think About It",
                 prompt_args={
@@ -1191,7 +1191,7 @@ Format as proper Markdown with:
 
 Make it professional and comprehensive enough for open-source release."""
 
-        documentation = self.ApiClient.prompt_agent(
+        documentation = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -1503,7 +1503,7 @@ Remember to:
 - Put the full OpenSCAD code in the <answer> tag inside of a OpenSCAD code block like: ```openscad\nOpenSCAD code block\n```"""
 
         # Generate OpenSCAD code with full reasoning process
-        scad_response = self.ApiClient.prompt_agent(
+        scad_response = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
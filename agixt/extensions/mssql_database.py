@@ -108,7 +108,7 @@ class mssql_database(Extensions):
         except Exception as e:
             logging.error(f"Error executing SQL Query: {str(e)}")
             # Reformat the query if it is invalid
-            new_query = self.ApiClient.prompt_agent(
+            new_query = await self.ApiClient.prompt_agent_async(
                 agent_id=self.agent_id,
                 prompt_name="Validate MSSQL",
                 prompt_args={
@@ -223,7 +223,7 @@ class mssql_database(Extensions):
         # Generate SQL query based on the schema and natural language query
         # Get datetime down to the second
         date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        sql_query = self.ApiClient.prompt_agent(
+        sql_query = await self.ApiClient.prompt_agent_async(
             agent_id=self.agent_id,
             prompt_name="Think About It",
             prompt_args={
@@ -93,7 +93,7 @@ class mysql_database(Extensions):
         except Exception as e:
             logging.error(f"Error executing SQL Query: {str(e)}")
             # Reformat the query if it is invalid.
-            new_query = self.ApiClient.prompt_agent(
+            new_query = await self.ApiClient.prompt_agent_async(
                 agent_name=self.agent_name,
                 prompt_name="Validate SQL",
                 prompt_args={
@@ -150,7 +150,7 @@ class mysql_database(Extensions):
         # Generate SQL query based on the schema and natural language query
         # Get datetime down to the second
         date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        sql_query = self.ApiClient.prompt_agent(
+        sql_query = await self.ApiClient.prompt_agent_async(
             agent_name=self.agent_name,
             prompt_name="Think About It",
             prompt_args={
@@ -3,19 +3,52 @@ Model Context Protocol (MCP) Client Implementation for AGiXT
 
 This module provides a proper MCP client that follows the protocol specification
 for interacting with MCP servers.
+
+Clients are expensive to create (stdio servers are child processes, HTTP
+servers hand out sessions), so callers should go through the module-level
+`mcp_sessions` manager, which keeps one long-lived client per server config,
+restarts crashed stdio servers and caches tool listings until the server says
+they changed.
 """
 
+import os
 import json
+import time
 import uuid
 import asyncio
+import hashlib
 import aiohttp
-from typing import Dict, Any, Optional, List, Union
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Union, Callable, Tuple
+from urllib.parse import urljoin
 from enum import Enum
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Default deadline for a single request to an MCP server
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+# How long to wait for a server to come up and answer `initialize`
+CONNECT_TIMEOUT = 30.0
+
+# Best-effort deadline for delivering notifications/cancelled
+CANCEL_NOTIFY_TIMEOUT = 5.0
+
+# asyncio's default 64 KiB line limit is too small for large tool results
+STDIO_READ_LIMIT = 16 * 1024 * 1024
+
+# Admin-configured servers, a JSON object mapping a server name to its config,
+# e.g. {"browser": {"transport": "stdio", "command": "npx", "args": [...]}}.
+# Stdio servers can only be reached through these names.
+MCP_SERVERS_ENV = "MCP_SERVERS"
+
+# JSON-RPC error codes used by the MCP SDKs for client-side failures
+CONNECTION_CLOSED_CODE = -32000
+REQUEST_TIMEOUT_CODE = -32001
+METHOD_NOT_FOUND_CODE = -32601
+
 
 class MCPError(Exception):
     """MCP-specific error"""
@@ -27,8 +60,28 @@ class MCPError(Exception):
         super().__init__(f"MCP Error {self.code}: {self.message}")
 
 
+class MCPTimeoutError(MCPError):
+    """A request exceeded its deadline and was cancelled on the server"""
+
+    def __init__(self, method: str, timeout: float):
+        super().__init__(
+            {
+                "code": REQUEST_TIMEOUT_CODE,
+                "message": f"Request '{method}' timed out after {timeout:g}s",
+            }
+        )
+
+
+class MCPConnectionError(MCPError):
+    """The connection to the MCP server was lost or could not be established"""
+
+    def __init__(self, message: str):
+        super().__init__({"code": CONNECTION_CLOSED_CODE, "message": message})
+
+
 class TransportType(Enum):
     HTTP = "http"
+    SSE = "sse"
     STDIO = "stdio"
 
 
@@ -60,70 +113,408 @@ class JSONRPCMessage:
         return message
 
 
-class HTTPTransport:
-    """HTTP transport with Server-Sent Events support for MCP"""
+async def _iter_sse_events(stream: aiohttp.StreamReader):
+    """
+    Parse a Server-Sent Events stream into (event, data) pairs.
+
+    Reads raw chunks rather than using aiohttp's line iterator, which refuses
+    lines longer than 128 KiB (large tool results arrive as one data line).
+    """
+    buffer = bytearray()
+    event = None
+    data = []
+    async for chunk in stream.iter_any():
+        buffer.extend(chunk)
+        while True:
+            index = buffer.find(b"\n")
+            if index < 0:
+                break
+            line = bytes(buffer[:index]).decode("utf-8").rstrip("\r")
+            del buffer[: index + 1]
+            if not line:
+                if data:
+                    yield event or "message", "\n".join(data)
+                event, data = None, []
+                continue
+            if line.startswith(":"):
+                continue
+            name, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if name == "event":
+                event = value
+            elif name == "data":
+                data.append(value)
+    if data:
+        yield event or "message", "\n".join(data)
+
+
+class _BaseTransport:
+    """
+    Request/response bookkeeping shared by all transports.
+
+    Subclasses implement `_send` for one outgoing message and feed every
+    incoming message to `_dispatch`, which resolves pending requests, runs
+    notification handlers and answers server-initiated requests.
+    """
+
+    def __init__(self):
+        self.notification_handlers = {}
+        self.closed = False
+        self._pending_requests: Dict[Any, asyncio.Future] = {}
+        self._background_tasks = set()
+
+    @property
+    def connected(self) -> bool:
+        raise NotImplementedError
+
+    async def _send(self, message: dict):
+        raise NotImplementedError
+
+    async def send_request(
+        self, request: dict, timeout: Optional[float] = None
+    ) -> dict:
+        """
+        Send a JSON-RPC request and wait for its response.
+
+        If the deadline passes or the caller is cancelled, the server is sent
+        `notifications/cancelled` so it can stop working on the request.
+        """
+        if not self.connected:
+            raise MCPConnectionError("Transport not connected")
+        request_id = request.get("id")
+        future = asyncio.get_running_loop().create_future()
+        self._pending_requests[request_id] = future
+        try:
+            return await asyncio.wait_for(self._exchange(request, future), timeout)
+        except asyncio.TimeoutError:
+            await self._cancel_request(request, f"Request timed out after {timeout:g}s")
+            raise MCPTimeoutError(request.get("method"), timeout)
+        except asyncio.CancelledError:
+            task = asyncio.ensure_future(
+                self._cancel_request(request, "Request cancelled by client")
+            )
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            raise
+        finally:
+            self._pending_requests.pop(request_id, None)
+
+    async def send_notification(self, notification: dict):
+        """Send JSON-RPC notification (no response expected)"""
+        if not self.connected:
+            raise MCPConnectionError("Transport not connected")
+        await self._send(notification)
+
+    def register_notification_handler(self, method: str, handler):
+        """Register a handler for server notifications"""
+        self.notification_handlers[method] = handler
+
+    async def _exchange(self, request: dict, future: asyncio.Future) -> dict:
+        await self._send(request)
+        return await future
+
+    async def _cancel_request(self, request: dict, reason: str):
+        # The protocol forbids cancelling initialize
+        if request.get("method") == "initialize" or not self.connected:
+            return
+        notification = JSONRPCMessage.notification(
+            "notifications/cancelled",
+            {"requestId": request.get("id"), "reason": reason},
+        )
+        try:
+            await asyncio.wait_for(self._send(notification), CANCEL_NOTIFY_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"Could not send cancellation for {request.get('id')}: {e}")
+
+    async def _dispatch(self, message: Union[dict, list]):
+        """Route one incoming JSON-RPC message (or batch)"""
+        if isinstance(message, list):
+            for item in message:
+                await self._dispatch(item)
+            return
+        if not isinstance(message, dict):
+            return
+        method = message.get("method")
+        if method is not None:
+            if "id" in message:
+                await self._handle_server_request(message)
+                return
+            handler = self.notification_handlers.get(method)
+            if handler:
+                try:
+                    await handler(message.get("params", {}))
+                except Exception as e:
+                    logger.error(f"Error handling MCP notification {method}: {e}")
+            return
+        future = self._pending_requests.pop(message.get("id"), None)
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    async def _handle_server_request(self, message: dict):
+        """Answer requests the server sends to the client"""
+        if message["method"] == "ping":
+            response = {"jsonrpc": "2.0", "id": message["id"], "result": {}}
+        else:
+            response = {
+                "jsonrpc": "2.0",
+                "id": message["id"],
+                "error": {
+                    "code": METHOD_NOT_FOUND_CODE,
+                    "message": f"Method not supported by client: {message['method']}",
+                },
+            }
+        try:
+            await self._send(response)
+        except Exception as e:
+            logger.debug(f"Could not answer server request {message['method']}: {e}")
+
+    def _fail_pending(self, reason: str):
+        """Fail every in-flight request, e.g. when the server goes away"""
+        pending = list(self._pending_requests.values())
+        self._pending_requests.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(MCPConnectionError(reason))
+
+
+class HTTPTransport(_BaseTransport):
+    """
+    Streamable HTTP transport for MCP.
+
+    Every message is POSTed to the endpoint. The server answers with either a
+    JSON body or an SSE stream that may carry notifications before the final
+    response. An optional GET stream receives server-initiated messages such as
+    `notifications/tools/list_changed`.
+    """
 
     def __init__(
         self, endpoint_url: str, auth_headers: Optional[Dict[str, str]] = None
     ):
+        super().__init__()
         self.endpoint_url = endpoint_url
         self.auth_headers = auth_headers or {}
         self.session: Optional[aiohttp.ClientSession] = None
         self.sse_task: Optional[asyncio.Task] = None
-        self.notification_handlers = {}
+        self.session_id: Optional[str] = None
+        self.protocol_version: Optional[str] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.session is not None and not self.session.closed and not self.closed
 
     async def connect(self):
         """Establish HTTP connection"""
-        self.session = aiohttp.ClientSession(headers=self.auth_headers)
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=self.auth_headers)
+        self.closed = False
 
     async def disconnect(self):
-        """Close HTTP connection"""
+        """Close the event stream, end the server session and close the pool"""
+        self.closed = True
         if self.sse_task:
             self.sse_task.cancel()
-        if self.session:
+            self.sse_task = None
+        if self.session and not self.session.closed:
+            if self.session_id:
+                try:
+                    async with self.session.delete(
+                        self.endpoint_url,
+                        headers=self._headers(),
+                        timeout=aiohttp.ClientTimeout(total=CANCEL_NOTIFY_TIMEOUT),
+                    ):
+                        pass
+                except Exception as e:
+                    logger.debug(f"Could not end MCP session {self.session_id}: {e}")
             await self.session.close()
-
-    async def send_request(self, request: dict) -> dict:
-        """Send JSON-RPC request and wait for response"""
-        if not self.session:
+        self.session_id = None
+        self._fail_pending("Transport disconnected")
+
+    def _headers(self, accept: str = "application/json, text/event-stream"):
+        headers = {"Accept": accept}
+        if self.session_id:
+            headers["Mcp-Session-Id"] = self.session_id
+        if self.protocol_version:
+            headers["MCP-Protocol-Version"] = self.protocol_version
+        return headers
+
+    async def _send(self, message: dict):
+        if not self.connected:
             await self.connect()
-
-        async with self.session.post(self.endpoint_url, json=request) as response:
+        async with self.session.post(
+            self.endpoint_url, json=message, headers=self._headers()
+        ) as response:
+            if response.status == 404 and self.session_id:
+                self.closed = True
+                raise MCPConnectionError("MCP session expired on the server")
             response.raise_for_status()
-            return await response.json()
+            session_id = response.headers.get("Mcp-Session-Id")
+            if session_id:
+                self.session_id = session_id
+            if response.status == 202:
+                return
+            content_type = response.headers.get("Content-Type", "")
+            if content_type.startswith("text/event-stream"):
+                await self._consume_events(response, until_id=message.get("id"))
+            elif "json" in content_type:
+                body = await response.read()
+                if body.strip():
+                    await self._dispatch(json.loads(body))
+
+    async def _consume_events(self, response, until_id=None):
+        async for event, data in _iter_sse_events(response.content):
+            if event != "message":
+                continue
+            try:
+                await self._dispatch(json.loads(data))
+            except json.JSONDecodeError:
+                logger.debug(f"Ignoring malformed SSE payload: {data[:200]}")
+            if until_id is not None and until_id not in self._pending_requests:
+                # Our response has arrived; the server may keep the stream open
+                return
+
+    def open_event_stream(self):
+        """Start listening for server-initiated messages on a GET stream"""
+        if self.sse_task is None or self.sse_task.done():
+            self.sse_task = asyncio.create_task(self._handle_sse_events())
 
-    async def send_notification(self, notification: dict):
-        """Send JSON-RPC notification (no response expected)"""
-        if not self.session:
-            await self.connect()
+    async def _handle_sse_events(self):
+        """Handle Server-Sent Events for server-to-client messages"""
+        delay = 1.0
+        while self.connected:
+            try:
+                async with self.session.get(
+                    self.endpoint_url,
+                    headers=self._headers(accept="text/event-stream"),
+                    timeout=aiohttp.ClientTimeout(total=None, sock_read=None),
+                ) as response:
+                    if response.status == 405:
+                        # The server does not offer a standalone stream
+                        return
+                    response.raise_for_status()
+                    delay = 1.0
+                    await self._consume_events(response)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"MCP event stream from {self.endpoint_url} failed: {e}")
+            if not self.connected:
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
 
-        async with self.session.post(self.endpoint_url, json=notification) as response:
-            response.raise_for_status()
 
-    def register_notification_handler(self, method: str, handler):
-        """Register a handler for server notifications"""
-        self.notification_handlers[method] = handler
+class SSETransport(_BaseTransport):
+    """
+    HTTP+SSE transport from the 2024-11-05 protocol revision.
 
-    async def _handle_sse_events(self):
-        """Handle Server-Sent Events for server-to-client messages"""
-        # This would implement SSE handling for receiving server notifications
-        # For now, this is a placeholder
-        pass
+    Responses arrive on a long-lived GET stream whose first `endpoint` event
+    names the URL that messages must be POSTed to.
+    """
+
+    def __init__(
+        self, endpoint_url: str, auth_headers: Optional[Dict[str, str]] = None
+    ):
+        super().__init__()
+        self.endpoint_url = endpoint_url
+        self.auth_headers = auth_headers or {}
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.sse_task: Optional[asyncio.Task] = None
+        self.post_url: Optional[str] = None
+        self._endpoint_ready: Optional[asyncio.Future] = None
+
+    @property
+    def connected(self) -> bool:
+        return (
+            self.session is not None
+            and not self.session.closed
+            and self.post_url is not None
+            and not self.closed
+        )
 
+    async def connect(self):
+        """Open the event stream and wait for the message endpoint"""
+        self.closed = False
+        self.session = aiohttp.ClientSession(headers=self.auth_headers)
+        self._endpoint_ready = asyncio.get_running_loop().create_future()
+        self.sse_task = asyncio.create_task(self._handle_sse_events())
+        try:
+            self.post_url = await asyncio.wait_for(
+                asyncio.shield(self._endpoint_ready), CONNECT_TIMEOUT
+            )
+        except Exception as e:
+            await self.disconnect()
+            raise MCPConnectionError(f"MCP SSE endpoint unavailable: {e}")
 
-class StdioTransport:
+    async def disconnect(self):
+        """Close the event stream and the HTTP session"""
+        self.closed = True
+        if self.sse_task:
+            self.sse_task.cancel()
+            self.sse_task = None
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self._fail_pending("Transport disconnected")
+
+    async def _send(self, message: dict):
+        async with self.session.post(self.post_url, json=message) as response:
+            response.raise_for_status()
+
+    async def _handle_sse_events(self):
+        error = None
+        try:
+            async with self.session.get(
+                self.endpoint_url,
+                headers={"Accept": "text/event-stream"},
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=None),
+            ) as response:
+                response.raise_for_status()
+                async for event, data in _iter_sse_events(response.content):
+                    if event == "endpoint":
+                        if not self._endpoint_ready.done():
+                            self._endpoint_ready.set_result(
+                                urljoin(self.endpoint_url, data.strip())
+                            )
+                        continue
+                    try:
+                        await self._dispatch(json.loads(data))
+                    except json.JSONDecodeError:
+                        logger.debug(f"Ignoring malformed SSE payload: {data[:200]}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+            logger.warning(f"MCP SSE stream from {self.endpoint_url} failed: {e}")
+        finally:
+            if self._endpoint_ready and not self._endpoint_ready.done():
+                self._endpoint_ready.set_exception(
+                    error or MCPConnectionError("SSE stream closed")
+                )
+            self.closed = True
+            self._fail_pending("MCP SSE stream closed")
+
+
+class StdioTransport(_BaseTransport):
     """Standard I/O transport for local MCP servers"""
 
     def __init__(
         self, command: str, args: List[str] = None, env: Optional[Dict[str, str]] = None
     ):
+        super().__init__()
         self.command = command
         self.args = args or []
         self.env = env
         self.process: Optional[asyncio.subprocess.Process] = None
         self.read_task: Optional[asyncio.Task] = None
-        self.notification_handlers = {}
-        self._pending_requests = {}
+        self.stderr_task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return (
+            self.process is not None
+            and self.process.returncode is None
+            and not self.closed
+        )
 
     async def connect(self):
         """Start the MCP server process"""
@@ -132,86 +523,85 @@ class StdioTransport:
         # Use provided environment or copy current environment
         process_env = self.env.copy() if self.env else os.environ.copy()
 
-        self.process = await asyncio.create_subprocess_exec(
-            self.command,
-            *self.args,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            env=process_env,
-        )
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                self.command,
+                *self.args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=process_env,
+                limit=STDIO_READ_LIMIT,
+            )
+        except OSError as e:
+            raise MCPConnectionError(f"Could not start MCP server {self.command}: {e}")
+        self.closed = False
 
-        # Start reading from stdout
+        # Start reading from stdout, and drain stderr so the server never
+        # blocks on a full pipe
         self.read_task = asyncio.create_task(self._read_messages())
+        self.stderr_task = asyncio.create_task(self._drain_stderr())
 
     async def disconnect(self):
         """Stop the MCP server process"""
-        if self.read_task:
-            self.read_task.cancel()
-        if self.process:
-            self.process.terminate()
-            await self.process.wait()
-
-    async def send_request(self, request: dict) -> dict:
-        """Send request via stdin and wait for response"""
-        if not self.process:
-            raise RuntimeError("Transport not connected")
-
-        request_id = request.get("id")
-        response_future = asyncio.Future()
-
-        # Store the future for this request ID
-        self._pending_requests[request_id] = response_future
-
-        # Send the request
-        request_line = json.dumps(request) + "\n"
-        self.process.stdin.write(request_line.encode())
-        await self.process.stdin.drain()
-
-        # Wait for the response
-        return await response_future
-
-    async def send_notification(self, notification: dict):
-        """Send notification via stdin (no response expected)"""
-        if not self.process:
-            raise RuntimeError("Transport not connected")
-
-        # Send the notification
-        notification_line = json.dumps(notification) + "\n"
-        self.process.stdin.write(notification_line.encode())
-        await self.process.stdin.drain()
-
-    def register_notification_handler(self, method: str, handler):
-        """Register a handler for server notifications"""
-        self.notification_handlers[method] = handler
+        self.closed = True
+        for task in (self.read_task, self.stderr_task):
+            if task:
+                task.cancel()
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.stdin.close()
+                self.process.terminate()
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+            except ProcessLookupError:
+                pass
+        self._fail_pending("Transport disconnected")
+
+    async def _send(self, message: dict):
+        if not self.connected:
+            raise MCPConnectionError(f"MCP server {self.command} is not running")
+        line = json.dumps(message) + "\n"
+        try:
+            self.process.stdin.write(line.encode())
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise MCPConnectionError(f"MCP server {self.command} closed stdin: {e}")
 
     async def _read_messages(self):
         """Read messages from stdout"""
-        while True:
-            try:
+        try:
+            while True:
                 line = await self.process.stdout.readline()
                 if not line:
                     break
-
-                message = json.loads(line.decode().strip())
-
-                # Handle response
-                if "id" in message:
-                    request_id = message["id"]
-                    if request_id in self._pending_requests:
-                        self._pending_requests[request_id].set_result(message)
-                        del self._pending_requests[request_id]
-
-                # Handle notification
-                elif "method" in message:
-                    method = message["method"]
-                    if method in self.notification_handlers:
-                        await self.notification_handlers[method](
-                            message.get("params", {})
-                        )
-
-            except Exception as e:
-                logger.error(f"Error reading message: {e}")
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.debug(f"Ignoring non-JSON output from {self.command}")
+                    continue
+                await self._dispatch(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading message: {e}")
+        finally:
+            if not self.closed:
+                logger.warning(f"MCP server {self.command} exited unexpectedly")
+            self.closed = True
+            self._fail_pending(f"MCP server {self.command} exited")
+
+    async def _drain_stderr(self):
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            logger.debug(f"[{self.command}] {line.decode(errors='replace').rstrip()}")
 
 
 class MCPClient:
@@ -219,13 +609,23 @@ class MCPClient:
     MCP Client implementation following the Model Context Protocol specification
     """
 
-    def __init__(self, transport_type: TransportType, **transport_params):
+    def __init__(
+        self,
+        transport_type: TransportType,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        **transport_params,
+    ):
         self.transport_type = transport_type
         self.transport = self._create_transport(transport_type, transport_params)
+        self.request_timeout = request_timeout
         self.initialized = False
         self.server_capabilities = {}
         self.server_info = {}
         self.protocol_version = "2025-06-18"
+        self.tools_version = 0
+        self._tools_cache: Optional[List[dict]] = None
+        self._tools_lock: Optional[asyncio.Lock] = None
+        self._tools_listeners: List[Callable[[], Any]] = []
 
     def _create_transport(self, transport_type: TransportType, params: dict):
         """Create the appropriate transport instance"""
@@ -234,6 +634,11 @@ class MCPClient:
                 endpoint_url=params.get("endpoint_url"),
                 auth_headers=params.get("auth_headers", {}),
             )
+        elif transport_type == TransportType.SSE:
+            return SSETransport(
+                endpoint_url=params.get("endpoint_url"),
+                auth_headers=params.get("auth_headers", {}),
+            )
         elif transport_type == TransportType.STDIO:
             return StdioTransport(
                 command=params.get("command"),
@@ -243,12 +648,18 @@ class MCPClient:
         else:
             raise ValueError(f"Unsupported transport type: {transport_type}")
 
+    @property
+    def connected(self) -> bool:
+        """Whether the underlying transport is still usable"""
+        return self.initialized and self.transport.connected
+
     async def connect(self):
         """Connect to the MCP server"""
         await self.transport.connect()
 
     async def disconnect(self):
         """Disconnect from the MCP server"""
+        self.initialized = False
         await self.transport.disconnect()
 
     async def initialize(self, client_info: Optional[dict] = None) -> dict:
@@ -265,6 +676,11 @@ class MCPClient:
         if not client_info:
             client_info = {"name": "AGiXT-MCP-Client", "version": "1.0.0"}
 
+        # Handlers must be in place before the server can send anything
+        self.transport.register_notification_handler(
+            "notifications/tools/list_changed", self._handle_tools_changed
+        )
+
         # Send initialize request
         response = await self._request(
             "initialize",
@@ -278,40 +694,75 @@ class MCPClient:
                 },
                 "clientInfo": client_info,
             },
+            timeout=CONNECT_TIMEOUT,
         )
 
         # Store server capabilities
         self.server_capabilities = response.get("capabilities", {})
         self.server_info = response.get("serverInfo", {})
+        negotiated_version = response.get("protocolVersion", self.protocol_version)
+        if isinstance(self.transport, HTTPTransport):
+            self.transport.protocol_version = negotiated_version
 
         # Send initialized notification
         await self._notify("notifications/initialized")
 
         self.initialized = True
 
-        # Register notification handlers if server supports them
-        if self.server_capabilities.get("tools", {}).get("listChanged"):
-            self.transport.register_notification_handler(
-                "notifications/tools/list_changed", self._handle_tools_changed
-            )
+        if isinstance(self.transport, HTTPTransport):
+            self.transport.open_event_stream()
 
         return {
             "capabilities": self.server_capabilities,
             "serverInfo": self.server_info,
         }
 
-    async def list_tools(self) -> List[dict]:
-        """List available tools from the server"""
+    async def ping(self, timeout: Optional[float] = None) -> dict:
+        """Check that the server is responsive"""
+        return await self._request("ping", timeout=timeout)
+
+    async def list_tools(self, refresh: bool = False) -> List[dict]:
+        """
+        List available tools from the server
+
+        The listing is cached until the server sends
+        `notifications/tools/list_changed` or `refresh` is set.
+        """
         self._ensure_initialized()
 
         if not self.server_capabilities.get("tools"):
             return []
 
-        response = await self._request("tools/list")
-        return response.get("tools", [])
+        if self._tools_lock is None:
+            self._tools_lock = asyncio.Lock()
+        async with self._tools_lock:
+            if self._tools_cache is not None and not refresh:
+                return list(self._tools_cache)
+            version = self.tools_version
+            tools = []
+            cursor = None
+            while True:
+                response = await self._request(
+                    "tools/list", {"cursor": cursor} if cursor else None
+                )
+                tools.extend(response.get("tools", []))
+                cursor = response.get("nextCursor")
+                if not cursor:
+                    break
+            # A change notification that raced the listing makes it stale
+            if version == self.tools_version:
+                self._tools_cache = tools
+            return list(tools)
+
+    def add_tools_listener(self, listener: Callable[[], Any]):
+        """Register a callback run whenever the server's tool list changes"""
+        self._tools_listeners.append(listener)
 
     async def call_tool(
-        self, name: str, arguments: Optional[dict] = None
+        self,
+        name: str,
+        arguments: Optional[dict] = None,
+        timeout: Optional[float] = None,
     ) -> List[dict]:
         """
         Call a tool on the server
@@ -319,6 +770,7 @@ class MCPClient:
         Args:
             name: Tool name
             arguments: Tool arguments
+            timeout: Deadline in seconds, defaults to the client's request_timeout
 
         Returns:
             List of content objects
@@ -329,7 +781,9 @@ class MCPClient:
             raise RuntimeError("Server does not support tools")
 
         response = await self._request(
-            "tools/call", {"name": name, "arguments": arguments or {}}
+            "tools/call",
+            {"name": name, "arguments": arguments or {}},
+            timeout=timeout,
         )
 
         return response.get("content", [])
@@ -395,10 +849,29 @@ class MCPClient:
 
         return response
 
-    async def _request(self, method: str, params: Optional[dict] = None) -> dict:
+    async def request(
+        self,
+        method: str,
+        params: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        """Send an arbitrary MCP request and return its result"""
+        self._ensure_initialized()
+        if method == "tools/list" and not params:
+            return {"tools": await self.list_tools()}
+        return await self._request(method, params, timeout=timeout)
+
+    async def _request(
+        self,
+        method: str,
+        params: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
         """Send a request and wait for response"""
         request = JSONRPCMessage.request(method, params)
-        response = await self.transport.send_request(request)
+        response = await self.transport.send_request(
+            request, timeout=timeout or self.request_timeout
+        )
 
         # Check for error
         if "error" in response:
@@ -419,18 +892,297 @@ class MCPClient:
     async def _handle_tools_changed(self, params: dict):
         """Handle tools list changed notification"""
         logger.info("Tools list changed on server")
-        # In a real implementation, this might trigger a refresh of cached tools
+        self.tools_version += 1
+        self._tools_cache = None
+        for listener in list(self._tools_listeners):
+            try:
+                result = listener()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error in MCP tools listener: {e}")
+
+
+def get_configured_servers() -> Dict[str, dict]:
+    """Server configs the administrator defined in MCP_SERVERS, by name"""
+    raw = os.getenv(MCP_SERVERS_ENV, "").strip()
+    if not raw:
+        return {}
+    try:
+        servers = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid {MCP_SERVERS_ENV} JSON: {e}")
+        return {}
+    if not isinstance(servers, dict):
+        logger.error(f"{MCP_SERVERS_ENV} must map server names to configs")
+        return {}
+    return {
+        name: config for name, config in servers.items() if isinstance(config, dict)
+    }
+
+
+def parse_server_config(server: Union[str, dict]) -> dict:
+    """
+    Normalise a server reference into a config dict.
+
+    URLs become HTTP configs (or SSE configs when the path ends in /sse). Any
+    other string must name a server configured in MCP_SERVERS; command lines
+    are never executed from a string, since these references can come from
+    model-chosen command arguments.
+    """
+    if isinstance(server, dict):
+        return server
+    server = server.strip()
+    if server.startswith(("http://", "https://")):
+        transport = "sse" if server.rstrip("/").endswith("/sse") else "http"
+        return {"transport": transport, "endpoint_url": server}
+    config = get_configured_servers().get(server)
+    if config is None:
+        raise ValueError(
+            f"Unknown MCP server '{server}'. Use an http(s) URL or a server "
+            f"name configured in {MCP_SERVERS_ENV}."
+        )
+    return dict(config)
+
+
+def create_client(
+    server_config: dict, request_timeout: float = DEFAULT_REQUEST_TIMEOUT
+) -> MCPClient:
+    """Build an unconnected client for a server config"""
+    transport_type = TransportType(server_config.get("transport", "http"))
+    if transport_type in (TransportType.HTTP, TransportType.SSE):
+        return MCPClient(
+            transport_type,
+            request_timeout=request_timeout,
+            endpoint_url=server_config["endpoint_url"],
+            auth_headers=server_config.get("auth_headers", {}),
+        )
+    return MCPClient(
+        transport_type,
+        request_timeout=request_timeout,
+        command=server_config["command"],
+        args=server_config.get("args", []),
+        env=server_config.get("env"),
+    )
+
+
+def _config_key(server_config: dict) -> str:
+    encoded = json.dumps(server_config, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+@dataclass
+class _PooledSession:
+    client: MCPClient
+    config: dict
+    loop: asyncio.AbstractEventLoop
+    started_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    restarts: int = 0
+
+
+class MCPSessionManager:
+    """
+    Pool of long-lived MCP clients keyed by server config.
+
+    Asyncio transports are bound to the loop that created them, so sessions are
+    pooled per event loop. A session whose stdio server crashed or whose HTTP
+    session expired is transparently reconnected on next use, with exponential
+    backoff when it keeps failing.
+    """
+
+    def __init__(
+        self,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        idle_timeout: float = 600.0,
+        max_restarts: int = 5,
+        restart_backoff: float = 0.5,
+        restart_window: float = 60.0,
+    ):
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        self.max_restarts = max_restarts
+        self.restart_backoff = restart_backoff
+        self.restart_window = restart_window
+        self._sessions: Dict[Tuple[int, str], _PooledSession] = {}
+        self._locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+        self.stats = {"connects": 0, "reuses": 0, "restarts": 0, "evictions": 0}
+
+    async def get_client(self, server: Union[str, dict]) -> MCPClient:
+        """Return a connected, initialised client for the server"""
+        server_config = parse_server_config(server)
+        loop = asyncio.get_running_loop()
+        key = (id(loop), _config_key(server_config))
+        await self._evict_idle(loop)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(key)
+            if session is not None and session.loop is not loop:
+                # A previous loop with the same id has been closed
+                self._sessions.pop(key, None)
+                session = None
+            if session is not None and session.client.connected:
+                session.last_used = time.monotonic()
+                self.stats["reuses"] += 1
+                return session.client
+
+            restarts = 0
+            if session is not None:
+                restarts = await self._restart_delay(session)
+                await self._close_client(session.client)
+                self.stats["restarts"] += 1
+            client = create_client(server_config, self.request_timeout)
+            try:
+                await client.connect()
+                await client.initialize()
+            except Exception:
+                await self._close_client(client)
+                self._sessions.pop(key, None)
+                raise
+            self.stats["connects"] += 1
+            self._sessions[key] = _PooledSession(
+                client=client, config=server_config, loop=loop, restarts=restarts
+            )
+            return client
+
+    async def _restart_delay(self, session: _PooledSession) -> int:
+        if time.monotonic() - session.started_at > self.restart_window:
+            return 1
+        restarts = session.restarts + 1
+        if restarts > self.max_restarts:
+            raise MCPConnectionError(
+                f"MCP server restarted {session.restarts} times within "
+                f"{self.restart_window:g}s, giving up"
+            )
+        delay = min(self.restart_backoff * 2 ** (restarts - 1), 30.0)
+        logger.warning(f"Restarting MCP server in {delay:g}s (attempt {restarts})")
+        await asyncio.sleep(delay)
+        return restarts
+
+    async def list_tools(
+        self, server: Union[str, dict], refresh: bool = False
+    ) -> List[dict]:
+        client = await self.get_client(server)
+        return await client.list_tools(refresh=refresh)
+
+    async def call_tool(
+        self,
+        server: Union[str, dict],
+        name: str,
+        arguments: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> List[dict]:
+        client = await self.get_client(server)
+        return await client.call_tool(name, arguments, timeout=timeout)
+
+    async def call_method(
+        self,
+        server: Union[str, dict],
+        method: str,
+        params: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        client = await self.get_client(server)
+        return await client.request(method, params, timeout=timeout)
+
+    async def close(self, server: Union[str, dict]):
+        """Shut down the pooled session for one server on the current loop"""
+        loop = asyncio.get_running_loop()
+        key = (id(loop), _config_key(parse_server_config(server)))
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            await self._close_client(session.client)
+
+    async def close_all(self):
+        """Shut down every pooled session owned by the current loop"""
+        loop = asyncio.get_running_loop()
+        for key, session in list(self._sessions.items()):
+            if session.loop is loop:
+                self._sessions.pop(key, None)
+                await self._close_client(session.client)
+            elif session.loop.is_closed():
+                self._sessions.pop(key, None)
+
+    async def _evict_idle(self, loop: asyncio.AbstractEventLoop):
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if session.loop.is_closed():
+                self._sessions.pop(key, None)
+                self._locks.pop(key, None)
+            elif session.loop is loop and now - session.last_used > self.idle_timeout:
+                if self._locks.get(key) and self._locks[key].locked():
+                    continue
+                self._sessions.pop(key, None)
+                self.stats["evictions"] += 1
+                await self._close_client(session.client)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "sessions": len(self._sessions)}
+
+    @staticmethod
+    async def _close_client(client: MCPClient):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.debug(f"Error closing MCP client: {e}")
+
+
+mcp_sessions = MCPSessionManager()
 
 
 # AGiXT Integration Helper
 class AGiXTMCPAdapter:
     """
     Adapter to integrate MCP client with AGiXT's extension system
+
+    Clients come from the shared session pool, so adapters are cheap to create
+    per agent turn and servers are not respawned each time.
     """
 
-    def __init__(self, user_api_key: Optional[str] = None):
+    def __init__(
+        self,
+        user_api_key: Optional[str] = None,
+        session_manager: Optional[MCPSessionManager] = None,
+    ):
         self.clients: Dict[str, MCPClient] = {}
+        self.server_configs: Dict[str, dict] = {}
         self.user_api_key = user_api_key
+        self.session_manager = session_manager or mcp_sessions
+
+    def resolve_server_config(self, server_config: dict) -> dict:
+        """Apply AGiXT-specific settings to a server config"""
+        transport_type = TransportType(server_config.get("transport", "http"))
+        if transport_type != TransportType.STDIO:
+            return dict(server_config)
+
+        # Handle AGiXT integration for stdio transports (like browser-use)
+        config = dict(server_config)
+        env = dict(server_config.get("env", {}))
+
+        # Auto-configure browser-use to use AGiXT if it's a browser-use server
+        if "browser-use" in server_config.get("command", "") and self.user_api_key:
+            from Globals import getenv
+
+            agixt_uri = getenv("AGIXT_URI", "http://localhost:7437")
+            agent_name = server_config.get("agent_name", "gpt-4o")
+
+            # Configure browser-use to use AGiXT as OpenAI-compatible provider
+            env["OPENAI_API_KEY"] = self.user_api_key
+            env["OPENAI_BASE_URL"] = f"{agixt_uri}/v1/mcp/"
+            env["BROWSER_USE_MODEL"] = agent_name  # Use agent name as model
+
+            # Optimal defaults for vision models
+            env["BROWSER_USE_HEADLESS"] = "true"
+            env["BROWSER_USE_VIEWPORT_WIDTH"] = "1280"
+            env["BROWSER_USE_VIEWPORT_HEIGHT"] = "720"
+
+            logger.info(f"Configured browser-use MCP server to use AGiXT:")
+            logger.info(f"  - Base URL: {env['OPENAI_BASE_URL']}")
+            logger.info(f"  - Model (Agent): {agent_name}")
+            logger.info(f"  - Headless: true, Viewport: 1280x720")
+
+        config["env"] = env
+        return config
 
     async def connect_to_server(self, server_id: str, server_config: dict) -> MCPClient:
         """
@@ -440,74 +1192,38 @@ class AGiXTMCPAdapter:
             server_id: Unique identifier for this server connection
             server_config: Configuration including transport type and parameters
         """
-        transport_type = TransportType(server_config.get("transport", "http"))
-
-        if transport_type == TransportType.HTTP:
-            client = MCPClient(
-                transport_type,
-                endpoint_url=server_config["endpoint_url"],
-                auth_headers=server_config.get("auth_headers", {}),
-            )
-        elif transport_type == TransportType.STDIO:
-            # Handle AGiXT integration for stdio transports (like browser-use)
-            env = server_config.get("env", {}).copy()
-
-            # Auto-configure browser-use to use AGiXT if it's a browser-use server
-            if "browser-use" in server_config.get("command", "") and self.user_api_key:
-                from Globals import getenv
-
-                agixt_uri = getenv("AGIXT_URI", "http://localhost:7437")
-                agent_name = server_config.get("agent_name", "gpt-4o")
-
-                # Configure browser-use to use AGiXT as OpenAI-compatible provider
-                env["OPENAI_API_KEY"] = self.user_api_key
-                env["OPENAI_BASE_URL"] = f"{agixt_uri}/v1/mcp/"
-                env["BROWSER_USE_MODEL"] = agent_name  # Use agent name as model
-
-                # Optimal defaults for vision models
-                env["BROWSER_USE_HEADLESS"] = "true"
-                env["BROWSER_USE_VIEWPORT_WIDTH"] = "1280"
-                env["BROWSER_USE_VIEWPORT_HEIGHT"] = "720"
-
-                logger.info(f"Configured browser-use MCP server to use AGiXT:")
-                logger.info(f"  - Base URL: {env['OPENAI_BASE_URL']}")
-                logger.info(f"  - Model (Agent): {agent_name}")
-                logger.info(f"  - Headless: true, Viewport: 1280x720")
-
-            client = MCPClient(
-                transport_type,
-                command=server_config["command"],
-                args=server_config.get("args", []),
-                env=env,
-            )
-        else:
-            raise ValueError(f"Unsupported transport: {transport_type}")
-
-        await client.connect()
-        await client.initialize()
-
+        config = self.resolve_server_config(server_config)
+        client = await self.session_manager.get_client(config)
+        self.server_configs[server_id] = config
         self.clients[server_id] = client
         return client
 
-    async def execute_mcp_action(self, server_id: str, action: str, **kwargs) -> Any:
+    async def execute_mcp_action(
+        self, server_id: str, action: str, timeout: Optional[float] = None, **kwargs
+    ) -> Any:
         """
         Execute an action on an MCP server
 
         Args:
             server_id: Server identifier
             action: Action to perform (list_tools, call_tool, etc.)
+            timeout: Deadline in seconds for tool calls
             **kwargs: Action-specific parameters
         """
-        if server_id not in self.clients:
+        if server_id not in self.server_configs:
             raise ValueError(f"No client connected for server: {server_id}")
 
-        client = self.clients[server_id]
+        # Re-acquire so a crashed server is restarted before use
+        client = await self.session_manager.get_client(self.server_configs[server_id])
+        self.clients[server_id] = client
 
         if action == "list_tools":
             return await client.list_tools()
         elif action == "call_tool":
             return await client.call_tool(
-                name=kwargs["tool_name"], arguments=kwargs.get("arguments", {})
+                name=kwargs["tool_name"],
+                arguments=kwargs.get("arguments", {}),
+                timeout=timeout,
             )
         elif action == "list_resources":
             return await client.list_resources()
@@ -523,7 +1239,10 @@ class AGiXTMCPAdapter:
             raise ValueError(f"Unknown action: {action}")
 
     async def disconnect_all(self):
-        """Disconnect all MCP clients"""
-        for client in self.clients.values():
-            await client.disconnect()
+        """
+        Release this adapter's clients
+
+        Connections stay in the shared pool for reuse and are closed when idle.
+        """
         self.clients.clear()
+        self.server_configs.clear()
@@ -21,6 +21,8 @@ from Globals import getenv
 discord_bot_manager_task: Optional[asyncio.Task] = None
 # Track Outreach Bot Manager task
 outreach_bot_manager_task: Optional[asyncio.Task] = None
+# Bot worker processes when bots are sharded (BOT_WORKERS > 1)
+bot_worker_processes: list = []
 
 
 class StartupTimer:
@@ -449,10 +451,41 @@ async def start_service(is_restart=False):
         raise
 
 
+def start_bot_workers(worker_count: int):
+    """Start one BotRuntime process per bot worker; each runs its share of companies."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "BotRuntime.py")
+    for index in range(worker_count):
+        env = {
+            **os.environ,
+            "BOT_WORKERS": str(worker_count),
+            "BOT_WORKER_INDEX": str(index),
+        }
+        bot_worker_processes.append(subprocess.Popen([sys.executable, script], env=env))
+    logger.info(f"✅ Started {worker_count} bot worker processes")
+
+
+def stop_bot_workers():
+    """Stop the bot worker processes, letting them release their leases."""
+    for process in bot_worker_processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in bot_worker_processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    bot_worker_processes.clear()
+
+
 async def start_discord_bots():
     """Start the Discord Bot Manager as a background task."""
     global discord_bot_manager_task
 
+    worker_count = int(getenv("BOT_WORKERS", "1") or "1")
+    if worker_count > 1:
+        start_bot_workers(worker_count)
+        return
+
     try:
         from DiscordBotManager import start_discord_bot_manager
 
@@ -469,6 +502,11 @@ async def stop_discord_bots():
     """Stop the Discord Bot Manager."""
     global discord_bot_manager_task
 
+    if bot_worker_processes:
+        await asyncio.to_thread(stop_bot_workers)
+        logger.info("Bot worker processes stopped")
+        return
+
     try:
         from DiscordBotManager import stop_discord_bot_manager
 
@@ -606,6 +644,8 @@ async def monitor_loop():
 def signal_handler(signum, frame):
     """Handle shutdown signals."""
 
+    stop_bot_workers()
+
     # Stop Discord bots (sync wrapper)
     try:
         from DiscordBotManager import stop_discord_bot_manager
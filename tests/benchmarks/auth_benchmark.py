@@ -0,0 +1,391 @@
+"""
+Benchmark per-request authentication overhead and database queries.
+
+Serves three representative routes with FastAPI's TestClient:
+- GET /agents: require_scope("agents:read") plus verify_api_key, like
+  most agent, chain and prompt routes
+- GET /conversations: verify_api_key plus the user's company, like the
+  conversation routes
+- PUT /roles: require_all_scopes("roles:read", "roles:write") plus
+  verify_api_key
+
+Each route is served twice:
+- legacy: the dependencies as they were. verify_api_key checks the 5 second
+  token cache, then queries TokenBlacklist and User. require_scope decodes the
+  JWT again, queries UserCompany for super admin status and resolves the
+  company (10 second cache) and scopes (60 second cache).
+- context: require_scope and verify_api_key share one AuthContext per request
+  through request.state. Revocation is checked against the cached digest set.
+
+The user, membership, blacklist and scope tables live in an in-memory SQLite
+database with the same lookups MagicalAuth runs, and every statement is
+counted. A virtual clock advances by 1/rps seconds per request, so cache TTLs
+expire as they would under that load.
+
+Usage:
+    python tests/benchmarks/auth_benchmark.py [--requests 3000] [--users 50]
+        [--rps 200]
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+
+import jwt
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.testclient import TestClient
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt import AuthContext as auth_module  # noqa: E402
+from agixt.AuthContext import (  # noqa: E402
+    AuthContext,
+    AuthContextResolver,
+    RevocationList,
+    get_auth_context,
+    get_request_auth_context,
+    scope_matches,
+    token_digest,
+)
+
+SECRET = "benchmark-secret-that-is-long-enough-for-hs256"
+ROLE_SCOPES = {
+    0: [],
+    2: ["agents:read", "agents:write", "roles:read", "roles:write"],
+    3: ["agents:read", "conversations:read"],
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+
+class VirtualCache:
+    """SharedCache stand-in whose TTLs follow the virtual clock"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.values = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is None:
+            return None
+        if value[1] is not None and value[1] <= self.clock.now:
+            del self.values[key]
+            return None
+        return value[0]
+
+    def set(self, key, value, ttl=0):
+        self.values[key] = (value, self.clock.now + ttl if ttl else None)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def delete_pattern(self, pattern):
+        prefix = pattern.split("*")[0]
+        for key in [key for key in self.values if key.startswith(prefix)]:
+            del self.values[key]
+
+
+class Database:
+    def __init__(self, users):
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.connection.executescript(
+            """
+            CREATE TABLE user (id TEXT PRIMARY KEY, email TEXT, first_name TEXT,
+                created_at TEXT);
+            CREATE TABLE user_company (user_id TEXT, company_id TEXT,
+                role_id INTEGER);
+            CREATE TABLE token_blacklist (token TEXT UNIQUE, expires_at REAL);
+            CREATE TABLE default_role_scope (role_id INTEGER, scope TEXT);
+            CREATE TABLE user_custom_role_scope (user_id TEXT, company_id TEXT,
+                scope TEXT);
+            CREATE INDEX user_company_user ON user_company (user_id);
+            """
+        )
+        for index in range(users):
+            user_id = f"user-{index}"
+            self.connection.execute(
+                "INSERT INTO user VALUES (?, ?, ?, '2024-01-01T00:00:00')",
+                (user_id, f"{user_id}@example.com", f"User {index}"),
+            )
+            role = 2 if index % 5 == 0 else 3
+            self.connection.execute(
+                "INSERT INTO user_company VALUES (?, 'company-1', ?)", (user_id, role)
+            )
+        for role, scopes in ROLE_SCOPES.items():
+            self.connection.executemany(
+                "INSERT INTO default_role_scope VALUES (?, ?)",
+                [(role, scope) for scope in scopes],
+            )
+        for index in range(200):
+            self.connection.execute(
+                "INSERT INTO token_blacklist VALUES (?, ?)", (f"revoked-{index}", 1e12)
+            )
+
+    def query(self, sql, *args):
+        with self.lock:
+            self.queries += 1
+            return self.connection.execute(sql, args).fetchall()
+
+    def user(self, user_id):
+        rows = self.query(
+            "SELECT id, email, first_name, created_at FROM user WHERE id = ?", user_id
+        )
+        return dict(zip(("id", "email", "first_name", "created_at"), rows[0]))
+
+    def memberships(self, user_id):
+        return self.query(
+            "SELECT company_id, role_id FROM user_company WHERE user_id = ?", user_id
+        )
+
+    def scopes(self, user_id, company_id, role_id):
+        scopes = {
+            row[0]
+            for row in self.query(
+                "SELECT scope FROM default_role_scope WHERE role_id = ?", role_id
+            )
+        }
+        scopes.update(
+            row[0]
+            for row in self.query(
+                "SELECT scope FROM user_custom_role_scope "
+                "WHERE user_id = ? AND company_id = ?",
+                user_id,
+                company_id,
+            )
+        )
+        return scopes
+
+
+def decode(authorization):
+    token = str(authorization).replace("Bearer ", "")
+    claims = jwt.decode(token, SECRET, algorithms=["HS256"])
+    return token, claims
+
+
+def legacy_dependencies(db, cache):
+    """verify_api_key and require_scope as they were before AuthContext"""
+
+    def verify_api_key(authorization: str = Header(None)):
+        token = str(authorization).replace("Bearer ", "")
+        cached = cache.get(f"token_validation:{token_digest(token)}")
+        if cached is not None:
+            return cached
+        if db.query("SELECT 1 FROM token_blacklist WHERE token = ?", token):
+            raise HTTPException(status_code=401)
+        _, claims = decode(token)
+        user = db.user(claims["sub"])
+        cache.set(f"token_validation:{token_digest(token)}", user, ttl=5)
+        return user
+
+    def company_id(user_id):
+        cached = cache.get(f"user_company:{user_id}")
+        if cached is not None:
+            return cached
+        company = db.query(
+            "SELECT company_id FROM user_company WHERE user_id = ?", user_id
+        )[0][0]
+        cache.set(f"user_company:{user_id}", company, ttl=10)
+        return company
+
+    def has_scope(user_id, scope):
+        # MagicalAuth.has_scope asked is_super_admin() on every call
+        if db.query(
+            "SELECT 1 FROM user_company WHERE user_id = ? AND role_id = 0", user_id
+        ):
+            return True
+        company = company_id(user_id)
+        scopes = cache.get(f"user_scopes:{user_id}:{company}")
+        if scopes is None:
+            role_id = db.query(
+                "SELECT role_id FROM user_company WHERE user_id = ? AND company_id = ?",
+                user_id,
+                company,
+            )[0][0]
+            scopes = sorted(db.scopes(user_id, company, role_id))
+            cache.set(f"user_scopes:{user_id}:{company}", scopes, ttl=60)
+        return scope_matches(scope, set(scopes))
+
+    def require_scope(*scopes, require_all=False):
+        def scope_checker(authorization: str = Header(None)):
+            _, claims = decode(authorization)
+            check = all if require_all else any
+            if not check(has_scope(claims["sub"], scope) for scope in scopes):
+                raise HTTPException(status_code=403)
+
+        return scope_checker
+
+    def user_company(user: dict = Depends(verify_api_key)):
+        return company_id(user["id"])
+
+    return verify_api_key, require_scope, user_company
+
+
+def context_dependencies(db, cache):
+    """The same dependencies sharing one AuthContext per request"""
+
+    def load_context(token, source, identity):
+        user_id = identity["user_id"]
+        user = db.user(user_id)
+        memberships = db.memberships(user_id)
+        company_id, role_id = memberships[0]
+        cache.set(f"user_company:{user_id}", company_id, ttl=10)
+        is_super_admin = any(role == 0 for _, role in memberships)
+        scopes = set()
+        if not is_super_admin:
+            cached = cache.get(f"user_scopes:{user_id}:{company_id}")
+            if cached is None:
+                cached = sorted(db.scopes(user_id, company_id, role_id))
+                cache.set(f"user_scopes:{user_id}:{company_id}", cached, ttl=60)
+            scopes = set(cached)
+        return AuthContext(
+            token=token,
+            source=source,
+            user=user,
+            user_id=user_id,
+            email=user["email"],
+            company_id=company_id,
+            is_super_admin=is_super_admin,
+            scopes=scopes,
+        )
+
+    def load_revoked():
+        return [
+            token_digest(row[0])
+            for row in db.query("SELECT token FROM token_blacklist")
+        ]
+
+    auth_module.auth_context_resolver = AuthContextResolver(
+        cache=cache,
+        revocations=RevocationList(cache=cache, load=load_revoked),
+        load_context=load_context,
+        secret=SECRET,
+    )
+
+    def verify_api_key(authorization: str = Header(None), request: Request = None):
+        return get_request_auth_context(request, authorization).user_dict()
+
+    def require_scope(*scopes, require_all=False):
+        async def scope_checker(request: Request, authorization: str = Header(None)):
+            context = await get_auth_context(request, authorization)
+            check = context.has_all_scopes if require_all else context.has_any_scope
+            if not check(scopes):
+                raise HTTPException(status_code=403)
+
+        return scope_checker
+
+    async def user_company(context: AuthContext = Depends(get_auth_context)):
+        return context.company_id
+
+    return verify_api_key, require_scope, user_company
+
+
+def build_app(dependencies):
+    verify_api_key, require_scope, user_company = dependencies
+    app = FastAPI()
+
+    @app.get("/baseline")
+    async def baseline():
+        return {}
+
+    @app.get("/agents", dependencies=[Depends(require_scope("agents:read"))])
+    async def agents(user: dict = Depends(verify_api_key)):
+        return {"user": user["id"]}
+
+    @app.get("/conversations")
+    async def conversations(
+        user: dict = Depends(verify_api_key), company=Depends(user_company)
+    ):
+        return {"user": user["id"], "company": company}
+
+    @app.put(
+        "/roles",
+        dependencies=[
+            Depends(require_scope("roles:read", "roles:write", require_all=True))
+        ],
+    )
+    async def roles(user: dict = Depends(verify_api_key)):
+        return {"user": user["id"]}
+
+    return app
+
+
+def run(label, make_dependencies, args):
+    clock = Clock()
+    cache = VirtualCache(clock)
+    db = Database(args.users)
+    client = TestClient(build_app(make_dependencies(db, cache)))
+    tokens = [
+        jwt.encode(
+            {"sub": f"user-{index}", "email": f"user-{index}@example.com"},
+            SECRET,
+            algorithm="HS256",
+        )
+        for index in range(args.users)
+    ]
+    routes = [("GET", "/agents"), ("GET", "/conversations"), ("PUT", "/roles")]
+    results = {}
+    baseline = []
+    for method, path in routes:
+        results[path] = {"ms": [], "queries": 0, "requests": 0, "statuses": set()}
+    for number in range(args.requests):
+        clock.now += 1 / args.rps
+        headers = {"Authorization": f"Bearer {tokens[number % args.users]}"}
+        method, path = routes[number % len(routes)]
+        start = time.perf_counter()
+        client.get("/baseline", headers=headers)
+        baseline.append((time.perf_counter() - start) * 1000)
+        before = db.queries
+        start = time.perf_counter()
+        response = client.request(method, path, headers=headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        result = results[path]
+        result["ms"].append(elapsed)
+        result["queries"] += db.queries - before
+        result["requests"] += 1
+        result["statuses"].add(response.status_code)
+    floor = statistics.median(baseline)
+    for path, result in results.items():
+        timings = sorted(result["ms"])
+        print(
+            f"{label:>8} {path:<15} auth ms p50 "
+            f"{statistics.median(timings) - floor:6.3f} "
+            f"p95 {timings[int(len(timings) * 0.95)] - floor:6.3f}  "
+            f"queries/request {result['queries'] / result['requests']:.3f}  "
+            f"statuses {sorted(result['statuses'])}"
+        )
+    total = sum(result["queries"] for result in results.values())
+    return total / args.requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rps", type=float, default=200)
+    args = parser.parse_args()
+    print(
+        f"{args.requests} requests, {args.users} users, "
+        f"{args.rps:.0f} requests/s virtual; auth ms is over an unauthenticated route"
+    )
+    legacy = run("legacy", legacy_dependencies, args)
+    context = run("context", context_dependencies, args)
+    print(f"queries per request: legacy {legacy:.3f}, context {context:.3f}")
+    print(f"resolver stats: {auth_module.auth_context_resolver.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Benchmark chat bot message handling: one agent call per platform event against
+the conversation pipeline.
+
+Simulates conversations on a chat platform where users send bursts of short
+messages (typing "hi", then the question, then a correction), answered by a
+fake agent that waits before its first token and then streams the rest.
+
+- legacy: every message is its own agent call, and the reply is posted once
+  the whole response has been generated (the old Slack/Telegram path)
+- pipeline: messages go through ConversationPipeline (debounced into one turn
+  per burst, one turn at a time per conversation) and the reply is streamed
+  into a message with StreamingReply
+
+Reports agent calls per burst and time from the first message of a burst to
+the first visible reply text, plus the number of platform API calls made.
+
+Usage:
+    python tests/benchmarks/bot_pipeline_benchmark.py [--conversations 50]
+        [--bursts 3] [--burst-size 3] [--gap 0.3] [--first-token 1.5]
+        [--tokens 120] [--token-delay 0.02] [--speed 10]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.BotPipeline import (  # noqa: E402
+    ConversationPipeline,
+    InboundMessage,
+    StreamingReply,
+)
+from agixt.BotRuntime import CompanyInbox  # noqa: E402
+
+
+class FakeAgent:
+    """Streams a response after a fixed delay before the first token."""
+
+    def __init__(self, first_token, tokens, token_delay):
+        self.first_token = first_token
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.calls = 0
+
+    async def stream(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.first_token)
+        for index in range(self.tokens):
+            yield f"token{index} "
+            await asyncio.sleep(self.token_delay)
+
+
+class Platform:
+    """Counts API calls and records when each burst first shows reply text."""
+
+    def __init__(self):
+        self.sends = 0
+        self.edits = 0
+        self.first_reply = {}
+
+    def seen(self, burst):
+        self.first_reply.setdefault(burst, time.perf_counter())
+
+    def sender(self, burst):
+        async def send(text):
+            self.sends += 1
+            self.seen(burst)
+            return self.sends
+
+        return send
+
+    def editor(self, burst):
+        async def edit(handle, text):
+            self.edits += 1
+            self.seen(burst)
+
+        return edit
+
+
+def schedule(args):
+    """(conversation, burst, offset) for every message, bursts spaced apart."""
+    rng = random.Random(7)
+    events = []
+    for conversation in range(args.conversations):
+        start = rng.uniform(0, args.gap * args.burst_size)
+        for burst in range(args.bursts):
+            offset = start + burst * args.burst_interval
+            for _ in range(args.burst_size):
+                events.append((offset, conversation, (conversation, burst)))
+                offset += rng.uniform(args.gap / 2, args.gap)
+    return sorted(events)
+
+
+async def replay(events, submit):
+    started = time.perf_counter()
+    burst_started = {}
+    for offset, conversation, burst in events:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        burst_started.setdefault(burst, time.perf_counter())
+        submit(conversation, burst)
+    return burst_started
+
+
+async def run_legacy(args, events):
+    agent = FakeAgent(args.first_token, args.tokens, args.token_delay)
+    platform = Platform()
+    tasks = []
+
+    async def handle(burst):
+        response = "".join([token async for token in agent.stream("message")])
+        await platform.sender(burst)(response)
+
+    def submit(conversation, burst):
+        tasks.append(asyncio.create_task(handle(burst)))
+
+    burst_started = await replay(events, submit)
+    await asyncio.gather(*tasks)
+    return agent, platform, burst_started
+
+
+async def run_pipeline(args, events):
+    agent = FakeAgent(args.first_token, args.tokens, args.token_delay)
+    platform = Platform()
+    inbox = CompanyInbox("company", maxsize=args.conversations * 4, concurrency=64)
+
+    async def handle(turn):
+        burst = turn.raw["burst"]
+        reply = StreamingReply(send=platform.sender(burst), edit=platform.editor(burst))
+        async for delta in agent.stream(turn.text):
+            await reply.push(delta)
+        await reply.finish()
+
+    pipeline = ConversationPipeline(
+        handle,
+        inbox=inbox,
+        debounce=args.debounce,
+        max_wait=args.debounce * 4,
+    )
+
+    def submit(conversation, burst):
+        pipeline.submit(
+            InboundMessage(
+                platform="bench",
+                company_id="company",
+                conversation_key=str(conversation),
+                user_id=str(conversation),
+                text="message",
+                raw={"burst": burst},
+            )
+        )
+
+    burst_started = await replay(events, submit)
+    while pipeline.get_stats()["conversations"]:
+        await asyncio.sleep(0.01)
+    stats = pipeline.get_stats()
+    await pipeline.close()
+    await inbox.close()
+    return agent, platform, burst_started, stats
+
+
+def report(label, args, agent, platform, burst_started):
+    bursts = len(burst_started)
+    waits = sorted(
+        (platform.first_reply[burst] - started) * args.speed
+        for burst, started in burst_started.items()
+        if burst in platform.first_reply
+    )
+    p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0
+    print(
+        f"{label:<10} agent calls/burst {agent.calls / bursts:>5.2f} | "
+        f"first reply p50 {statistics.median(waits):>6.2f}s p95 {p95:>6.2f}s | "
+        f"api calls {platform.sends} sends + {platform.edits} edits"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--burst-size", type=int, default=3)
+    parser.add_argument(
+        "--gap", type=float, default=0.3, help="seconds between messages"
+    )
+    parser.add_argument("--first-token", type=float, default=1.5)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--debounce", type=float, default=1.0)
+    parser.add_argument(
+        "--speed", type=float, default=10, help="run this many times faster"
+    )
+    args = parser.parse_args()
+    # Later bursts start once the previous reply has been read
+    args.burst_interval = (
+        args.gap * args.burst_size
+        + args.first_token
+        + args.tokens * args.token_delay
+        + 5
+    )
+    scaled = argparse.Namespace(**vars(args))
+    for name in ("gap", "first_token", "token_delay", "debounce", "burst_interval"):
+        setattr(scaled, name, getattr(args, name) / args.speed)
+    events = schedule(scaled)
+    print(
+        f"{args.conversations} conversations x {args.bursts} bursts of "
+        f"{args.burst_size} messages, {len(events)} messages "
+        f"(times in simulated seconds, run {args.speed:g}x faster)"
+    )
+
+    agent, platform, burst_started = asyncio.run(run_legacy(scaled, events))
+    report("legacy", args, agent, platform, burst_started)
+    agent, platform, burst_started, stats = asyncio.run(run_pipeline(scaled, events))
+    report("pipeline", args, agent, platform, burst_started)
+    print(f"{'':>10} {stats}")
+
+
+if __name__ == "__main__":
+    main()
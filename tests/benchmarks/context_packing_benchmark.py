@@ -0,0 +1,174 @@
+"""
+Benchmark prompt context packing over a long simulated conversation.
+
+Replays a conversation turn by turn. Each turn sees the latest messages,
+recalled memories, activity blocks, a living summary and a persona, and
+every few turns the user imports a file. Messages vary from one line to
+pasted logs.
+
+For every turn it compares two policies:
+- the old one, which called the LLM reducer whenever the context exceeded
+  max_context_tokens
+- ContextPacker, which trims memories, history and activities itself and
+  needs the LLM only when the untrimmable sections alone overflow
+
+It reports how often each policy needs the LLM and the packing latency per
+turn, with the token count cache cold (every text new) and warm (counts
+carried over from earlier turns, as in a real conversation).
+
+Token counts use tiktoken's cl100k_base when it can be loaded, otherwise a
+regex word-piece approximation with similar cost per character.
+
+Usage:
+    python tests/benchmarks/context_packing_benchmark.py [--turns 300]
+        [--budget 24000] [--history 40] [--seed 0]
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.ContextPacker import (  # noqa: E402
+    TRIM_OLDEST,
+    ContextItem,
+    ContextPacker,
+    ContextSection,
+)
+
+WORDS = (
+    "deploy migration certificate invoice customer renewal replica backup "
+    "pipeline latency error timeout queue worker tenant webhook schema index "
+    "rollback release config secret cluster region quota throughput"
+).split()
+_PIECES = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def word_pieces(text):
+    return len(_PIECES.findall(text))
+
+
+def get_counter():
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return "tiktoken", lambda text: len(encoding.encode(text))
+    except Exception:
+        return "word pieces", word_pieces
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+
+
+def message(rng, turn, role):
+    size = rng.choices([12, 60, 250, 1500], weights=[50, 30, 15, 5])[0]
+    return f"Turn {turn} {role}: {sentence(rng, size)} \n "
+
+
+def build_sections(rng, turn, history, args):
+    memories = [
+        ContextItem(
+            f"Sourced from memory {turn}-{rank}:\n{sentence(rng, rng.randint(40, 400))}",
+            score=1 / (1 + rank),
+        )
+        for rank in range(15)
+    ]
+    activities = [
+        f"**[ACTIVITY] Step {turn}-{n}**\n- {sentence(rng, rng.randint(10, 120))}"
+        for n in range(12)
+    ]
+    sections = [
+        ContextSection(name="memories", items=memories, priority=2, share=0.2),
+        ContextSection(
+            name="conversation_history",
+            items=[ContextItem(text) for text in history[-args.history :]],
+            priority=1,
+            share=0.3,
+            trim=TRIM_OLDEST,
+        ),
+        ContextSection(
+            name="activities",
+            items=[ContextItem(block) for block in activities],
+            priority=3,
+            share=0.1,
+            trim=TRIM_OLDEST,
+            separator="\n\n",
+            prefix="### Recent Activities:\n",
+        ),
+        ContextSection.text("summary", sentence(random.Random(turn // 10), 600)),
+        ContextSection.text("persona", sentence(random.Random(1), 300)),
+    ]
+    if turn % 25 == 0:
+        size = rng.choice([2000, 8000, 30000])
+        sections.append(ContextSection.text("file_contents", sentence(rng, size)))
+    return sections
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--budget", type=int, default=24000)
+    parser.add_argument("--history", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    counter_name, count = get_counter()
+    rng = random.Random(args.seed)
+    fixed = count(sentence(random.Random(2), 3000))
+    warm = ContextPacker(count_tokens=count)
+    history = []
+    old_llm = 0
+    new_llm = 0
+    trimmed = 0
+    cold_ms = []
+    warm_ms = []
+    for turn in range(1, args.turns + 1):
+        history += [message(rng, turn, "user"), message(rng, turn, "assistant")]
+        state = rng.getstate()
+        sections = build_sections(rng, turn, history, args)
+        # The same turn again, packed with an empty count cache
+        rng.setstate(state)
+        cold_sections = build_sections(rng, turn, history, args)
+        _, cold = ContextPacker(count_tokens=count).pack(
+            cold_sections, args.budget, fixed
+        )
+        _, report = warm.pack(sections, args.budget, fixed)
+        cold_ms.append(cold.elapsed_ms)
+        warm_ms.append(report.elapsed_ms)
+        old_llm += report.original_tokens > args.budget
+        if report.needs_reduction:
+            new_llm += 1
+            warm.record_llm_reduction(report)
+        trimmed += not report.fits
+        if turn == args.turns:
+            print(report.summary())
+
+    def p95(values):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+    print(f"token counter: {counter_name}, budget {args.budget}, fixed {fixed}")
+    print(f"turns: {args.turns}, over budget before packing: {trimmed}")
+    print(
+        f"LLM reductions: previous policy {old_llm} "
+        f"({old_llm / args.turns:.0%}), packer {new_llm} ({new_llm / args.turns:.0%})"
+    )
+    print(
+        f"packing ms per turn: cold p50 {statistics.median(cold_ms):.2f} "
+        f"p95 {p95(cold_ms):.2f}, warm p50 {statistics.median(warm_ms):.2f} "
+        f"p95 {p95(warm_ms):.2f}"
+    )
+    print(f"stats: {warm.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Benchmark stopping conversations when requests land on any uvicorn worker.
+
+Simulated workers share an in-memory stand-in for Redis (each operation
+costs --redis-ms, as a network round trip would). Conversations run on one
+worker each, checking `is_stopped` between tokens; stop requests arrive at a
+random worker.
+
+- per-process: the registry without a shared cache, as before. Only stops
+  that happen to land on the owning worker work
+- shared: stops sent to the owner over pub/sub
+- shared, messages lost: the owner only learns of the stop at its next
+  heartbeat (every --heartbeat-ttl / 3 seconds)
+
+Reports how many stops took effect, request-to-stopped latency, and the cost
+of one `is_stopped` check.
+
+Usage:
+    python tests/benchmarks/conversation_stop_benchmark.py [--workers 4]
+        [--conversations 40] [--redis-ms 0.3] [--heartbeat-ttl 3]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.SharedCache import Subscription  # noqa: E402
+from agixt.WorkerRegistry import WorkerRegistry  # noqa: E402
+
+
+class SharedRedis:
+    def __init__(self, latency):
+        self.latency = latency
+        self.values = {}
+        self.subscriptions = []
+        self.drop_messages = False
+        self._lock = threading.Lock()
+
+    def _call(self):
+        time.sleep(self.latency)
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry and entry[1] and entry[1] <= time.time():
+            del self.values[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        self._call()
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else default
+
+    def set(self, key, value, ttl=0):
+        self._call()
+        with self._lock:
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+        return True
+
+    def set_if_not_exists(self, key, value, ttl=0):
+        self._call()
+        with self._lock:
+            if self._live(key):
+                return False
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+        return True
+
+    def delete(self, key):
+        self._call()
+        with self._lock:
+            return self.values.pop(key, None) is not None
+
+    def exists(self, key):
+        self._call()
+        with self._lock:
+            return self._live(key) is not None
+
+    def set_field(self, key, field, value, ttl=0):
+        self._call()
+        with self._lock:
+            entry = self._live(key) or ({}, None)
+            entry[0][field] = value
+            self.values[key] = (entry[0], time.time() + ttl if ttl else entry[1])
+        return True
+
+    def delete_field(self, key, field):
+        self._call()
+        with self._lock:
+            entry = self._live(key)
+            return bool(entry) and entry[0].pop(field, None) is not None
+
+    def get_fields(self, key):
+        self._call()
+        with self._lock:
+            entry = self._live(key)
+            return dict(entry[0]) if entry else {}
+
+    def publish(self, channel, message):
+        self._call()
+        if self.drop_messages:
+            return 0
+        with self._lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription._deliver(message)
+        return len(subscriptions)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, on_close=self._unsubscribe)
+        with self._lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions.remove(subscription)
+
+
+async def conversation(registry, conversation_id, stopped_at):
+    registry.register_conversation(
+        conversation_id, "user-1", "XT", task=asyncio.current_task()
+    )
+    try:
+        while not registry.is_stopped(conversation_id):
+            await asyncio.sleep(0.005)
+    finally:
+        stopped_at[conversation_id] = time.perf_counter()
+        registry.unregister_conversation(conversation_id)
+
+
+async def run(args, shared, drop_messages=False):
+    rng = random.Random(3)
+    redis = SharedRedis(args.redis_ms / 1000)
+    redis.drop_messages = drop_messages
+    registries = [
+        WorkerRegistry(
+            cache=redis if shared else None,
+            worker_id=f"worker-{index}",
+            heartbeat_ttl=args.heartbeat_ttl,
+        )
+        for index in range(args.workers)
+    ]
+    stopped_at, tasks = {}, {}
+    for index in range(args.conversations):
+        owner = registries[index % args.workers]
+        tasks[f"conv-{index}"] = asyncio.ensure_future(
+            conversation(owner, f"conv-{index}", stopped_at)
+        )
+    await asyncio.sleep(0.1)
+
+    latencies, effective = [], 0
+    for conversation_id, task in tasks.items():
+        requested = time.perf_counter()
+        await rng.choice(registries).stop_conversation(conversation_id, "user-1")
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=args.heartbeat_ttl)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        if conversation_id in stopped_at:
+            effective += 1
+            latencies.append(stopped_at[conversation_id] - requested)
+    for task in tasks.values():
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for registry in registries:
+        registry.close()
+    return effective, latencies
+
+
+def report(label, total, effective, latencies):
+    line = f"{label:<24} stopped {effective:>3}/{total}"
+    if latencies:
+        latencies = sorted(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        line += (
+            f" | latency p50 {statistics.median(latencies) * 1000:>7.1f}ms "
+            f"p95 {p95 * 1000:>7.1f}ms"
+        )
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--conversations", type=int, default=40)
+    parser.add_argument("--redis-ms", type=float, default=0.3)
+    parser.add_argument("--heartbeat-ttl", type=int, default=3)
+    args = parser.parse_args()
+    print(
+        f"{args.workers} workers, {args.conversations} conversations, "
+        f"stops sent to a random worker"
+    )
+    total = args.conversations
+    report("per-process", total, *asyncio.run(run(args, shared=False)))
+    report("shared", total, *asyncio.run(run(args, shared=True)))
+    report(
+        "shared, messages lost",
+        total,
+        *asyncio.run(run(args, shared=True, drop_messages=True)),
+    )
+
+    registry = WorkerRegistry(cache=SharedRedis(args.redis_ms / 1000))
+    registry.register_conversation("conv", "user-1", "XT")
+    checks = 200_000
+    started = time.perf_counter()
+    for _ in range(checks):
+        registry.is_stopped("conv")
+    per_check = (time.perf_counter() - started) / checks
+    registry.close()
+    print(f"is_stopped: {per_check * 1e9:.0f}ns per check (no cache round trip)")
+
+
+if __name__ == "__main__":
+    main()
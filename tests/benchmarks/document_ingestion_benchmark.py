@@ -0,0 +1,147 @@
+"""
+Benchmark document extraction: page-parallel PDFs and streamed zip extraction.
+
+Generates a multi-hundred-page text PDF and a large zip archive, then reports
+serial against process-pool PDF extraction time and zip extraction throughput
+and peak memory. Parallel speed-up needs more than one CPU.
+
+Usage:
+    python tests/benchmarks/document_ingestion_benchmark.py [--pages 500] [--workers 4]
+        [--zip-files 2000] [--zip-file-kb 256]
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt import DocumentIngestion  # noqa: E402
+
+
+def make_pdf(path, pages, lines_per_page=45):
+    """Write a plain Helvetica text PDF; page N's lines start with "Page N" """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(1, pages + 1):
+        lines = [
+            f"Page {page} line {line} lorem ipsum dolor sit amet consectetur {page * line}"
+            for line in range(1, lines_per_page + 1)
+        ]
+        stream = (
+            "BT /F1 10 Tf 14 TL 50 770 Td "
+            + " T* ".join(f"({line}) Tj" for line in lines)
+            + " ET"
+        ).encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        content_number = len(objects)
+        objects.append(
+            (
+                "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                "/Resources << /Font << /F1 3 0 R >> >> "
+                f"/Contents {content_number} 0 R >>"
+            ).encode("latin-1")
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = (f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>").encode(
+        "latin-1"
+    )
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objects) + 1, xref)
+        )
+
+
+def make_zip(path, files, file_bytes, directories=20):
+    """Deflated archive of `files` members spread over `directories` folders"""
+    block = os.urandom(1024)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for index in range(files):
+            data = (block * (file_bytes // len(block) + 1))[:file_bytes]
+            archive.writestr(f"dir{index % directories}/file{index}.bin", data)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_pdf(directory, pages, workers):
+    path = os.path.join(directory, "benchmark.pdf")
+    start = time.perf_counter()
+    make_pdf(path, pages)
+    print(
+        f"generated {pages}-page PDF ({os.path.getsize(path) / 1e6:.1f} MB) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    results = {}
+    for label, count in (("serial", 1), (f"{workers} workers", workers)):
+        DocumentIngestion.PDF_WORKERS = count
+        DocumentIngestion.shutdown_process_pool()
+        if count > 1:
+            # Start the workers outside the timed region
+            DocumentIngestion.get_process_pool().submit(int).result()
+        start = time.perf_counter()
+        document = DocumentIngestion.extract_pdf(path)
+        elapsed = time.perf_counter() - start
+        results[label] = elapsed
+        print(
+            f"pdf {label:<10} {elapsed:7.2f}s  {pages / elapsed:7.1f} pages/s  "
+            f"{len(document.text) / 1e6:.1f} MB text"
+        )
+    DocumentIngestion.shutdown_process_pool()
+    serial, parallel = results.values()
+    print(f"pdf speed-up      {serial / parallel:7.2f}x")
+
+
+def bench_zip(directory, files, file_kb):
+    path = os.path.join(directory, "benchmark.zip")
+    make_zip(path, files, file_kb * 1024)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    result = DocumentIngestion.extract_zip(path, os.path.join(directory, "extracted"))
+    elapsed = time.perf_counter() - start
+    print(
+        f"zip {result.files} files, {result.bytes_written / 1e6:.0f} MB in "
+        f"{elapsed:.2f}s ({result.bytes_written / 1e6 / elapsed:.0f} MB/s), "
+        f"peak RSS grew {peak_rss_mb() - rss_before:.1f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--zip-files", type=int, default=2000)
+    parser.add_argument("--zip-file-kb", type=int, default=256)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        bench_pdf(directory, args.pages, args.workers)
+        bench_zip(directory, args.zip_files, args.zip_file_kb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Benchmark /v1/embeddings style load: requests/second and event-loop lag.
+
+Builds a tiny ONNX encoder (an embedding table plus a few dense layers, using
+the repo's tokenizer) and fires concurrent single-text requests at it two
+ways: calling the embedder inline on the event loop, as the endpoint used to,
+and through the micro-batching EmbeddingBatcher. A ticker coroutine measures
+how late the event loop wakes it up while requests are in flight.
+
+It then runs OnnxEmbedder.benchmark to compare length-bucketed against
+fixed 256-token batches, for the float model and its int8-quantized copy.
+
+Requires onnx and onnxruntime.
+
+Usage:
+    python tests/benchmarks/embedding_benchmark.py [--clients 64] [--requests 2000]
+        [--window-ms 5] [--layers 6] [--hidden-size 384]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt import EmbeddingService  # noqa: E402
+from agixt.EmbeddingService import (  # noqa: E402
+    EmbeddingBatcher,
+    OnnxEmbedder,
+    quantize_model,
+)
+
+SENTENCES = [
+    "The deployment failed because the database migration timed out.",
+    "Remind me to renew the TLS certificate before the end of the month.",
+    "What did we decide about the pricing page in last week's meeting?",
+    "Summarize the attached quarterly report in three bullet points.",
+    "Error 0x80070005 appears when the service account lacks permissions.",
+]
+
+
+def make_tiny_model(directory, hidden_size=64, layers=4, seed=0):
+    """Write model.onnx and tokenizer.json for a small random encoder"""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    source = os.path.join(AGIXT_SRC, "onnx")
+    shutil.copy(os.path.join(source, "tokenizer.json"), directory)
+    with open(os.path.join(source, "vocab.txt"), encoding="utf-8") as f:
+        vocab_size = sum(1 for _ in f)
+    rng = np.random.default_rng(seed)
+    initializers = [
+        numpy_helper.from_array(
+            rng.standard_normal((vocab_size, hidden_size)).astype(np.float32),
+            "word_embeddings",
+        )
+    ]
+    initializers += [
+        numpy_helper.from_array(np.array([1], dtype=np.int64), "seq_axis"),
+        numpy_helper.from_array(np.array([2], dtype=np.int64), "hidden_axis"),
+    ]
+    # Each position also sees the mean of the unmasked positions, like
+    # attention does, so wrongly unmasked padding changes every vector
+    nodes = [
+        helper.make_node("Gather", ["word_embeddings", "input_ids"], ["tokens"]),
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("Unsqueeze", ["mask", "hidden_axis"], ["mask3"]),
+        helper.make_node("Mul", ["tokens", "mask3"], ["masked"]),
+        helper.make_node("ReduceSum", ["masked", "seq_axis"], ["context_sum"]),
+        helper.make_node("ReduceSum", ["mask3", "seq_axis"], ["context_count"]),
+        helper.make_node("Div", ["context_sum", "context_count"], ["context"]),
+        helper.make_node("Add", ["tokens", "context"], ["h0"]),
+    ]
+    for layer in range(layers):
+        weight = f"w{layer}"
+        initializers.append(
+            numpy_helper.from_array(
+                (
+                    rng.standard_normal((hidden_size, hidden_size)) / hidden_size**0.5
+                ).astype(np.float32),
+                weight,
+            )
+        )
+        output = "last_hidden_state" if layer == layers - 1 else f"h{layer + 1}"
+        nodes.append(helper.make_node("MatMul", [f"h{layer}", weight], [f"m{layer}"]))
+        nodes.append(helper.make_node("Tanh", [f"m{layer}"], [output]))
+    graph = helper.make_graph(
+        nodes,
+        "tiny_encoder",
+        [
+            helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "seq"])
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+        ],
+        [
+            helper.make_tensor_value_info(
+                "last_hidden_state",
+                TensorProto.FLOAT,
+                ["batch", "seq", hidden_size],
+            )
+        ],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    onnx.save(model, os.path.join(directory, "model.onnx"))
+
+
+async def run_load(embed_one, clients, requests):
+    """Returns (requests/second, [event loop lags in ms])"""
+    queue = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(f"{SENTENCES[index % len(SENTENCES)]} #{index}")
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append((time.perf_counter() - start - 0.005) * 1000)
+
+    async def client():
+        while not queue.empty():
+            await embed_one(queue.get_nowait())
+
+    ticking = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticking
+    return requests / elapsed, lags
+
+
+def report(label, throughput, lags):
+    lags = sorted(lags) or [0.0]
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(
+        f"{label:<8} {throughput:8.1f} req/s   loop lag p50 "
+        f"{statistics.median(lags):7.1f} ms  p99 {p99:7.1f} ms  max {lags[-1]:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--window-ms", type=float, default=5)
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--hidden-size", type=int, default=384)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        make_tiny_model(directory, hidden_size=args.hidden_size, layers=args.layers)
+        embedder = OnnxEmbedder(model_dir=directory)
+        embedder([SENTENCES[0]])  # load outside the timed region
+
+        async def inline(text):
+            return embedder([text])
+
+        throughput, lags = asyncio.run(run_load(inline, args.clients, args.requests))
+        report("inline", throughput, lags)
+
+        batcher = EmbeddingBatcher(embedder, window_ms=args.window_ms)
+
+        async def batched(text):
+            return await batcher.embed([text])
+
+        throughput, lags = asyncio.run(run_load(batched, args.clients, args.requests))
+        batcher.shutdown()
+        report("batched", throughput, lags)
+        print(
+            f"batched: {batcher.stats['requests']} requests in "
+            f"{batcher.stats['batches']} batches, "
+            f"{batcher.stats['model_calls']} model calls"
+        )
+
+        print(f"runtime: {OnnxEmbedder(model_dir=directory).benchmark()}")
+        quantize_model(directory)
+        EmbeddingService.EMBEDDING_QUANTIZED = True
+        print(f"int8:    {OnnxEmbedder(model_dir=directory).benchmark()}")
+
+
+if __name__ == "__main__":
+    main()
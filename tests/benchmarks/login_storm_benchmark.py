@@ -0,0 +1,214 @@
+"""
+Load test a login storm: memory and latency of other requests.
+
+Serves /login and a non-auth /ping route in one app and sends a burst of
+concurrent password logins. A pinger keeps requesting /ping throughout. Each
+mode verifies the same Argon2id hash with the production parameters (64 MB,
+2 passes):
+
+- event-loop: verify inline in the async handler, as /v1/login did
+- threadpool: verify in a 40 thread pool, as sync handlers run in Starlette
+- service: CredentialService with its bounded process pool and 429 admission
+
+For each mode it reports:
+- /ping latency during the storm
+- login outcomes by status code
+- peak resident memory of the process and its pool workers, above the
+  baseline before the storm
+
+Usage:
+    python tests/benchmarks/login_storm_benchmark.py [--logins 120]
+        [--modes event-loop threadpool service] [--workers 0]
+        [--queue-per-worker 4]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import psutil
+from fastapi import FastAPI, HTTPException, Request
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.CredentialService import (  # noqa: E402
+    CredentialService,
+    HashParameters,
+    TokenBucket,
+)
+
+PASSWORD = "correct horse battery staple"
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class MemorySampler(threading.Thread):
+    """Peak RSS of this process plus its children"""
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+
+    @staticmethod
+    def rss():
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+
+def build_app(mode, password_hash, service):
+    app = FastAPI()
+    hasher = HashParameters().hasher()
+    threads = ThreadPoolExecutor(max_workers=40)
+
+    def verify(password):
+        try:
+            return hasher.verify(password_hash, password)
+        except Exception:
+            return False
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.post("/login")
+    async def login(request: Request):
+        body = await request.json()
+        if mode == "event-loop":
+            ok = verify(body["password"])
+        elif mode == "threadpool":
+            ok = await asyncio.get_running_loop().run_in_executor(
+                threads, verify, body["password"]
+            )
+        else:
+            service.check_login(request.client.host, body["username"])
+            ok, _ = await service.verify(body["password"], password_hash)
+        if not ok:
+            raise HTTPException(status_code=401)
+        return {"ok": True}
+
+    return app
+
+
+async def storm(app, args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get("/ping")
+        pings = []
+        stop = asyncio.Event()
+
+        async def pinger():
+            # Latency counts from when the ping was due, so time the event
+            # loop spent blocked shows up
+            due = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/ping")
+                pings.append((time.perf_counter() - due) * 1000)
+                due = max(due + 0.02, time.perf_counter())
+
+        async def attempt(number):
+            password = PASSWORD if number % 4 == 0 else f"guess {number}"
+            response = await client.post(
+                "/login", json={"username": f"user{number % 30}", "password": password}
+            )
+            return response.status_code
+
+        pinging = asyncio.create_task(pinger())
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(attempt(n) for n in range(args.logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await pinging
+        return pings, Counter(statuses), elapsed
+
+
+def run(mode, args, password_hash):
+    service = None
+    if mode == "service":
+        cache = LocalCache()
+        service = CredentialService(
+            workers=args.workers,
+            queue_per_worker=args.queue_per_worker,
+            # One client sends the whole storm; keep the buckets out of the way
+            ip_bucket=TokenBucket("ip", 10**6, 10**6, cache=cache),
+            account_bucket=TokenBucket("account", 10**6, 10**6, cache=cache),
+        )
+        # Start the workers before measuring the baseline
+        service.verify_sync(PASSWORD, password_hash)
+    app = build_app(mode, password_hash, service)
+    baseline = MemorySampler.rss()
+    sampler = MemorySampler()
+    sampler.start()
+    pings, statuses, elapsed = asyncio.run(storm(app, args))
+    sampler.running = False
+    sampler.join()
+    pings.sort()
+    print(
+        f"{mode:>10}: ping p50 {statistics.median(pings):7.1f} ms "
+        f"p95 {pings[int(len(pings) * 0.95)]:7.1f} ms max {pings[-1]:7.1f} ms "
+        f"({len(pings)} pings) | logins {dict(sorted(statuses.items()))} "
+        f"in {elapsed:.1f}s | peak memory +{(sampler.peak - baseline) / 2**20:.0f} MB"
+    )
+    if service is not None:
+        print(f"{'':>10}  {service.get_stats()}")
+        service.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=120)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["event-loop", "threadpool", "service"],
+        choices=["event-loop", "threadpool", "service"],
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="0 sizes the pool from memory"
+    )
+    parser.add_argument("--queue-per-worker", type=int, default=4)
+    args = parser.parse_args()
+    password_hash = HashParameters().hasher().hash(PASSWORD)
+    print(f"{args.logins} concurrent logins, {os.cpu_count()} CPUs")
+    for mode in args.modes:
+        run(mode, args, password_hash)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark a streamed memory export piped straight into an import.
+
+Generates a synthetic collection (default: 1,000,000 memories with 384-dim
+vectors), exports it to NDJSON, feeds the bytes through the importer in 64 KB
+chunks and reports throughput, stream size and peak memory. Rows are
+generated lazily and the sink only counts them, so peak memory reflects the
+transfer pipeline itself.
+
+Usage:
+    python tests/benchmarks/memory_transfer_benchmark.py [--rows 1000000] [--dimensions 384]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.MemoryTransfer import export_ndjson, import_ndjson, iter_ndjson  # noqa: E402
+
+
+def synthetic_rows(count, dimensions):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1024, dimensions)).astype(np.float32)
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        yield SimpleNamespace(
+            conversation_id=None,
+            text=f"synthetic memory {i} " * 8,
+            description="benchmark",
+            external_source="user input",
+            additional_metadata="",
+            timestamp=start + timedelta(seconds=i),
+            embedding=vectors[i % 1024],
+        )
+
+
+async def chunked(lines, size=64 * 1024):
+    buffer = bytearray()
+    for line in lines:
+        buffer += line
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    args = parser.parse_args()
+
+    fingerprint = {"id": "benchmark", "dimensions": args.dimensions}
+    streamed = 0
+    inserted = 0
+
+    def counted(lines):
+        nonlocal streamed
+        for line in lines:
+            streamed += len(line)
+            yield line
+
+    def insert_rows(rows):
+        nonlocal inserted
+        inserted += len(rows)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    report = asyncio.run(
+        import_ndjson(
+            iter_ndjson(
+                chunked(
+                    counted(
+                        export_ndjson(
+                            synthetic_rows(args.rows, args.dimensions), fingerprint
+                        )
+                    )
+                )
+            ),
+            fingerprint=fingerprint,
+            insert_rows=insert_rows,
+            embed_texts=lambda texts: [],
+        )
+    )
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    assert report.complete and inserted == args.rows
+    print(f"memories:        {args.rows:,}")
+    print(f"stream size:     {streamed / 1e9:.2f} GB")
+    print(f"elapsed:         {elapsed:.1f} s ({args.rows / elapsed:,.0f} rows/s)")
+    print(f"peak RSS before: {rss_before / 1024:.0f} MB")
+    print(f"peak RSS after:  {rss_after / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Benchmark memory reranking: CPU latency per query and quality on the fixture.
+
+Builds a stand-in ONNX cross-encoder with the repo's tokenizer. It has the
+same inputs and output as an exported MiniLM cross-encoder: input_ids,
+attention_mask and token_type_ids in, one logit per pair out. It also has
+MiniLM-sized dense layers. Its score is the dot product of the mean query and
+mean memory token states, which is roughly word overlap. Its latency is
+therefore representative of a real model, but its ranking quality is not.
+Point `--reranker-dir` at a real exported model for meaningful quality numbers.
+
+For each candidate pool size it reports milliseconds per query for:
+- the cross-encoder with a cold cache
+- the same query answered again from the score cache
+- the lexical fallback
+
+It then runs the retrieval evaluation with and without reranking.
+
+Requires onnx and onnxruntime.
+
+Usage:
+    python tests/benchmarks/rerank_benchmark.py [--pools 10 20 40 80] [--rounds 5]
+        [--layers 6] [--hidden-size 384] [--reranker-dir path]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+for path in (PROJECT_ROOT, AGIXT_SRC, BENCHMARKS):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.Reranker import CrossEncoderScorer, LexicalScorer, Reranker  # noqa: E402
+from retrieval_eval import LocalScoreCache, evaluate  # noqa: E402
+
+MEMORY = (
+    "The nightly backup job copies the Postgres base backup to object storage "
+    "and keeps fourteen days of WAL segments for point in time recovery. "
+)
+QUERY = "How long do we keep WAL segments for recovery?"
+
+
+def make_tiny_cross_encoder(directory, hidden_size=64, layers=2, seed=0):
+    """Write model.onnx and tokenizer.json for a small random cross-encoder"""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    source = os.path.join(AGIXT_SRC, "onnx")
+    shutil.copy(os.path.join(source, "tokenizer.json"), directory)
+    with open(os.path.join(source, "vocab.txt"), encoding="utf-8") as f:
+        vocab_size = sum(1 for _ in f)
+    rng = np.random.default_rng(seed)
+    initializers = [
+        numpy_helper.from_array(
+            rng.standard_normal((vocab_size, hidden_size)).astype(np.float32),
+            "word_embeddings",
+        ),
+        numpy_helper.from_array(np.array([1], dtype=np.int64), "seq_axis"),
+        numpy_helper.from_array(np.array([2], dtype=np.int64), "hidden_axis"),
+        numpy_helper.from_array(np.array(1.0, dtype=np.float32), "one"),
+    ]
+    nodes = [helper.make_node("Gather", ["word_embeddings", "input_ids"], ["h0"])]
+    for layer in range(layers):
+        weight = f"w{layer}"
+        initializers.append(
+            numpy_helper.from_array(
+                (
+                    rng.standard_normal((hidden_size, hidden_size)) / hidden_size**0.5
+                ).astype(np.float32),
+                weight,
+            )
+        )
+        nodes.append(helper.make_node("MatMul", [f"h{layer}", weight], [f"m{layer}"]))
+        nodes.append(helper.make_node("Tanh", [f"m{layer}"], [f"h{layer + 1}"]))
+    hidden = f"h{layers}"
+    nodes += [
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("Cast", ["token_type_ids"], ["second"], to=TensorProto.FLOAT),
+        helper.make_node("Sub", ["one", "second"], ["first"]),
+        helper.make_node("Mul", ["mask", "first"], ["query_mask"]),
+        helper.make_node("Mul", ["mask", "second"], ["memory_mask"]),
+    ]
+    for part in ("query", "memory"):
+        nodes += [
+            helper.make_node(
+                "Unsqueeze", [f"{part}_mask", "hidden_axis"], [f"{part}_mask3"]
+            ),
+            helper.make_node("Mul", [hidden, f"{part}_mask3"], [f"{part}_states"]),
+            helper.make_node(
+                "ReduceSum",
+                [f"{part}_states", "seq_axis"],
+                [f"{part}_sum"],
+                keepdims=0,
+            ),
+            helper.make_node(
+                "ReduceSum",
+                [f"{part}_mask3", "seq_axis"],
+                [f"{part}_count"],
+                keepdims=0,
+            ),
+            helper.make_node("Div", [f"{part}_sum", f"{part}_count"], [f"{part}_mean"]),
+        ]
+    nodes += [
+        helper.make_node("Mul", ["query_mean", "memory_mean"], ["product"]),
+        helper.make_node("ReduceSum", ["product", "seq_axis"], ["logits"], keepdims=1),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "tiny_cross_encoder",
+        [
+            helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "seq"])
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+        ],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", 1])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    onnx.save(model, os.path.join(directory, "model.onnx"))
+
+
+def candidate_pool(size):
+    """Memories of mixed length, a few of them on topic"""
+    words = MEMORY.split()
+    pool = []
+    for index in range(size):
+        length = 20 + (index * 37) % 180
+        start = (index * 11) % len(words)
+        text = " ".join((words * 8)[start : start + length])
+        if index % 7:
+            text = " ".join(f"filler{(index + n) % 50}" for n in range(length))
+        pool.append((f"m{index}", text))
+    return pool
+
+
+def time_rerank(reranker, pool, rounds, query=QUERY, fresh_queries=True):
+    timings = []
+    for round_number in range(rounds):
+        text = f"{query} #{round_number}" if fresh_queries else query
+        start = time.perf_counter()
+        reranker.rerank(text, pool, limit=5)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pools", type=int, nargs="+", default=[10, 20, 40, 80])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--hidden-size", type=int, default=384)
+    parser.add_argument("--reranker-dir", default=None)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        model_dir = args.reranker_dir
+        if not model_dir:
+            make_tiny_cross_encoder(
+                directory, hidden_size=args.hidden_size, layers=args.layers
+            )
+            model_dir = directory
+        scorer = CrossEncoderScorer(model_dir)
+        scorer(QUERY, ["warmup"])
+        lexical = Reranker(scorer=LexicalScorer(), cache=LocalScoreCache())
+        print(f"threads: {scorer.intra_op_threads}")
+        print(f"{'pool':>6} {'cold ms':>9} {'cached ms':>10} {'lexical ms':>11}")
+        for size in args.pools:
+            pool = candidate_pool(size)
+            model = Reranker(scorer=scorer, cache=LocalScoreCache(), count_tokens=len)
+            cold = time_rerank(model, pool, args.rounds)
+            model.rerank(QUERY, pool, limit=5)
+            cached = time_rerank(model, pool, args.rounds, fresh_queries=False)
+            fallback = time_rerank(lexical, pool, args.rounds)
+            print(f"{size:>6} {cold:>9.1f} {cached:>10.2f} {fallback:>11.2f}")
+
+        for label, reranker_scorer in (
+            ("cross-encoder", scorer),
+            ("lexical", LexicalScorer()),
+        ):
+            reranker = Reranker(
+                scorer=reranker_scorer, cache=LocalScoreCache(), count_tokens=len
+            )
+            report = evaluate(embedder="hashing", reranker=reranker)
+            print(
+                f"{label}: "
+                + ", ".join(
+                    f"{mode} mrr {metrics['mrr']:.3f} recall@5 {metrics['recall@5']:.3f}"
+                    for mode, metrics in report.items()
+                    if mode in ("hybrid", "hybrid+rerank")
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
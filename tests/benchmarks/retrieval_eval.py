@@ -0,0 +1,284 @@
+"""
+Offline evaluation of memory retrieval: vector, lexical and hybrid.
+
+Loads a labelled fixture (documents plus queries with their relevant document
+ids) into a throwaway SQLite database with the same `memory` schema and
+full-text index the server uses, then reports recall@k, MRR and per-query
+latency for each retrieval mode.
+
+`--rerank` adds a "hybrid+rerank" mode that passes the hybrid candidates
+through Reranker: the ONNX cross-encoder in `--reranker-dir` when it holds
+one, otherwise the lexical fallback.
+
+The default embedder is the server's local ONNX model (Memories.embed), which
+needs the full AGiXT environment. `--embedder hashing` uses a deterministic
+character n-gram embedder instead so the harness can run anywhere; its
+absolute numbers are not meaningful, only the comparison between modes.
+
+Usage:
+    python tests/benchmarks/retrieval_eval.py [--fixture path.json] [--embedder onnx|hashing]
+        [--rerank] [--reranker-dir path]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.HybridRetrieval import (  # noqa: E402
+    candidate_count,
+    ensure_memory_text_index,
+    lexical_search,
+    rank_by_similarity,
+    reciprocal_rank_fusion,
+)
+from agixt.Reranker import (  # noqa: E402
+    RERANK_CANDIDATES,
+    CrossEncoderScorer,
+    LexicalScorer,
+    Reranker,
+)
+
+DEFAULT_FIXTURE = os.path.join(
+    os.path.dirname(__file__), "fixtures", "retrieval_eval.json"
+)
+MODES = ("vector", "lexical", "hybrid")
+RERANK_MODE = "hybrid+rerank"
+KS = (1, 5, 10)
+AGENT_ID = "eval-agent"
+
+MEMORY_TABLE = """
+CREATE TABLE memory (
+    id TEXT PRIMARY KEY,
+    agent_id TEXT NOT NULL,
+    conversation_id TEXT,
+    embedding TEXT,
+    text TEXT NOT NULL,
+    external_source TEXT,
+    description TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    additional_metadata TEXT
+)
+"""
+
+
+def hashing_embed(texts, dimensions=256):
+    """Bag of hashed words and character trigrams, L2 normalised"""
+    vectors = []
+    for value in texts:
+        vector = np.zeros(dimensions, dtype=np.float32)
+        lowered = value.lower()
+        features = lowered.split()
+        features += [lowered[i : i + 3] for i in range(max(0, len(lowered) - 2))]
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % dimensions
+            vector[index] += 1.0 if digest[4] % 2 else -1.0
+        norm = np.linalg.norm(vector)
+        vectors.append(vector / norm if norm else vector)
+    return vectors
+
+
+def get_embedder(name):
+    if name == "hashing":
+        return hashing_embed
+    from Memories import embed
+
+    return embed
+
+
+def recall_at_k(ranked, relevant, k):
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked, relevant):
+    for rank, key in enumerate(ranked, start=1):
+        if key in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+class EvalIndex:
+    """The fixture loaded into a temporary SQLite memory table"""
+
+    def __init__(self, documents, embed, reranker=None):
+        self.embed = embed
+        self.reranker = reranker
+        self.texts = {}
+        self.directory = tempfile.TemporaryDirectory()
+        engine = create_engine(
+            f"sqlite:///{os.path.join(self.directory.name, 'eval.db')}"
+        )
+        self.Session = sessionmaker(bind=engine)
+        vectors = embed([document["text"] for document in documents])
+        self.vectors = []
+        self.ids = {}
+        with self.Session() as session:
+            session.execute(text(MEMORY_TABLE))
+            for document, vector in zip(documents, vectors):
+                memory_id = str(uuid.uuid4())
+                self.ids[memory_id] = document["id"]
+                self.texts[memory_id] = document["text"]
+                vector = np.asarray(vector, dtype=np.float32)
+                self.vectors.append((memory_id, vector))
+                session.execute(
+                    text(
+                        "INSERT INTO memory (id, agent_id, embedding, text, "
+                        "external_source) VALUES (:id, :agent, :embedding, :text, :source)"
+                    ),
+                    {
+                        "id": memory_id,
+                        "agent": AGENT_ID,
+                        "embedding": json.dumps(vector.tolist()),
+                        "text": document["text"],
+                        "source": document.get("external_source", "user input"),
+                    },
+                )
+            session.commit()
+            ensure_memory_text_index(session)
+
+    def ranked(self, mode, query, limit):
+        if mode == RERANK_MODE:
+            pool = self.search("hybrid", query, RERANK_CANDIDATES, keys=True)
+            results = self.reranker.rerank(
+                query, [(key, self.texts[key]) for key in pool], limit=limit
+            )
+            return [self.ids[result.key] for result in results]
+        return self.search(mode, query, limit)
+
+    def search(self, mode, query, limit, keys=False):
+        candidates = candidate_count(limit)
+        vector_ids = []
+        lexical_ids = []
+        if mode in ("vector", "hybrid"):
+            query_vector = self.embed([query])[0]
+            vector_ids = [
+                key
+                for key, _ in rank_by_similarity(query_vector, self.vectors, candidates)
+            ]
+        if mode in ("lexical", "hybrid"):
+            with self.Session() as session:
+                lexical_ids = [
+                    key
+                    for key, _ in lexical_search(
+                        session, query, AGENT_ID, limit=candidates
+                    )
+                ]
+        if mode == "vector":
+            ranked = vector_ids
+        elif mode == "lexical":
+            ranked = lexical_ids
+        else:
+            ranked = [
+                key for key, _ in reciprocal_rank_fusion([vector_ids, lexical_ids])
+            ]
+        if keys:
+            return ranked[:limit]
+        return [self.ids[key] for key in ranked[:limit]]
+
+    def close(self):
+        self.directory.cleanup()
+
+
+def get_reranker(model_dir=None):
+    """The cross-encoder in model_dir when it has one, else the lexical fallback"""
+    scorer = CrossEncoderScorer(model_dir) if model_dir else None
+    if scorer is None or not scorer.available:
+        scorer = LexicalScorer()
+    # Each evaluation run starts cold
+    return Reranker(scorer=scorer, cache=LocalScoreCache(), count_tokens=len)
+
+
+class LocalScoreCache(dict):
+    def set(self, key, value, ttl=None):
+        self[key] = value
+
+
+def evaluate(fixture_path=DEFAULT_FIXTURE, embedder="onnx", ks=KS, reranker=None):
+    """
+    Return {mode: {"recall@k": ..., "mrr": ..., "p50_ms": ..., "by_kind": ...}}.
+    Passing a Reranker adds the hybrid+rerank mode.
+    """
+    with open(fixture_path, "r") as f:
+        fixture = json.load(f)
+    index = EvalIndex(fixture["documents"], get_embedder(embedder), reranker)
+    limit = max(ks)
+    report = {}
+    modes = MODES + ((RERANK_MODE,) if reranker else ())
+    try:
+        for mode in modes:
+            recalls = {k: [] for k in ks}
+            ranks = []
+            latencies = []
+            by_kind = {}
+            for item in fixture["queries"]:
+                start = time.perf_counter()
+                ranked = index.ranked(mode, item["query"], limit)
+                latencies.append((time.perf_counter() - start) * 1000)
+                for k in ks:
+                    recalls[k].append(recall_at_k(ranked, item["relevant"], k))
+                ranks.append(reciprocal_rank(ranked, item["relevant"]))
+                kind = by_kind.setdefault(item.get("kind", "all"), [])
+                kind.append(recall_at_k(ranked, item["relevant"], 5))
+            latencies.sort()
+            report[mode] = {
+                **{f"recall@{k}": statistics.mean(recalls[k]) for k in ks},
+                "mrr": statistics.mean(ranks),
+                "p50_ms": latencies[len(latencies) // 2],
+                "p95_ms": latencies[
+                    min(len(latencies) - 1, int(len(latencies) * 0.95))
+                ],
+                "recall@5_by_kind": {
+                    kind: statistics.mean(values) for kind, values in by_kind.items()
+                },
+            }
+    finally:
+        index.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE)
+    parser.add_argument("--embedder", choices=("onnx", "hashing"), default="onnx")
+    parser.add_argument("--rerank", action="store_true")
+    parser.add_argument("--reranker-dir", default=None)
+    args = parser.parse_args()
+
+    reranker = None
+    if args.rerank or args.reranker_dir:
+        reranker = get_reranker(args.reranker_dir)
+        print(f"reranker: {reranker.scorer.name}")
+    report = evaluate(args.fixture, args.embedder, reranker=reranker)
+    columns = [f"recall@{k}" for k in KS] + ["mrr", "p50_ms", "p95_ms"]
+    print(
+        f"{'mode':<13} " + " ".join(f"{c:>9}" for c in columns) + "  recall@5 by kind"
+    )
+    for mode, metrics in report.items():
+        kinds = ", ".join(
+            f"{kind} {value:.2f}" for kind, value in metrics["recall@5_by_kind"].items()
+        )
+        print(
+            f"{mode:<13} "
+            + " ".join(f"{metrics[c]:>9.3f}" for c in columns)
+            + f"  {kinds}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark spoken answers: sentence-by-sentence TTS one after another against
+the pipelined scheduler with its audio cache.
+
+Each turn speaks a short acknowledgment (drawn from a small set of recurring
+phrases) and then an answer whose sentences arrive from a fake LLM stream.
+The fake TTS provider waits --tts-first-chunk before its first chunk and then
+synthesizes faster than real time; the fake client plays audio in real time,
+scaled by --speed.
+
+- sequential: the session's old path. Each sentence is synthesized when the
+  previous one has finished playing, nothing is cached
+- pipelined: TTSScheduler synthesizing up to --ahead sentences behind the
+  one playing, with acknowledgments served from the AudioCache
+
+Reports the silent gap between consecutive sentences, turn start to first
+audio, and how many acknowledgments were served from the cache (answer
+sentences are all distinct, so every cache hit is a recurring phrase).
+
+Usage:
+    python tests/benchmarks/tts_pipeline_benchmark.py [--turns 12]
+        [--sentences 4] [--tts-first-chunk 0.35] [--llm-sentence 0.3]
+        [--ahead 2] [--speed 4]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.SpeechSynthesis import AudioCache, TTSProvider, TTSScheduler  # noqa: E402
+
+# 24kHz 16-bit mono, 100ms per chunk
+CHUNK_SECONDS = 0.1
+CHUNK = b"\x00" * int(24000 * 2 * CHUNK_SECONDS)
+ACKS = [
+    "Sure, one moment.",
+    "Let me check that.",
+    "Good question, give me a second.",
+    "On it.",
+]
+WORDS = "the report shows revenue grew in every region while costs stayed flat".split()
+
+
+class FakeTTS(TTSProvider):
+    def __init__(self, args):
+        self.args = args
+        self.requests = 0
+
+    async def synthesize(self, text, voice, language, audio_format):
+        self.requests += 1
+        await asyncio.sleep(self.args.tts_first_chunk / self.args.speed)
+        # Roughly 0.3s of speech per word, synthesized at 4x real time
+        for _ in range(max(1, int(len(text.split()) * 0.3 / CHUNK_SECONDS))):
+            yield CHUNK
+            await asyncio.sleep(CHUNK_SECONDS / 4 / self.args.speed)
+
+
+class Client:
+    """Plays each chunk in real time and remembers when audio started."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.first_audio = None
+
+    async def play(self, item, chunks):
+        async for _ in chunks:
+            if self.first_audio is None:
+                self.first_audio = time.perf_counter()
+            await asyncio.sleep(CHUNK_SECONDS / self.speed)
+
+
+def answer_sentences(rng, count):
+    return [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))).capitalize()
+        + "."
+        for _ in range(count)
+    ]
+
+
+async def run(args, turns, ahead, cache):
+    provider = FakeTTS(args)
+    client = Client(args.speed)
+    scheduler = TTSScheduler(provider, client.play, ahead=ahead, cache=cache)
+    first_audio = []
+    for ack, sentences in turns:
+        client.first_audio = None
+        started = time.perf_counter()
+        scheduler.enqueue(ack)
+        for sentence in sentences:
+            await asyncio.sleep(args.llm_sentence / args.speed)
+            scheduler.enqueue(sentence)
+        await scheduler.drain()
+        first_audio.append((client.first_audio - started) * args.speed)
+    await scheduler.close()
+    return scheduler.get_stats(), first_audio, provider.requests
+
+
+def report(label, stats, first_audio, requests, turns, speed):
+    gap = stats["stages"]["gap_between_sentences"]
+    print(
+        f"{label:<11} gap between sentences p50 {gap['p50'] * speed:>5.0f}ms "
+        f"p95 {gap['p95'] * speed:>5.0f}ms | first audio p50 "
+        f"{statistics.median(first_audio) * 1000:>5.0f}ms | TTS requests {requests:>3} "
+        f"| acknowledgment cache hits {stats['cache_hits']}/{turns}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--sentences", type=int, default=4)
+    parser.add_argument("--tts-first-chunk", type=float, default=0.35)
+    parser.add_argument(
+        "--llm-sentence",
+        type=float,
+        default=0.3,
+        help="seconds between answer sentences from the LLM stream",
+    )
+    parser.add_argument("--ahead", type=int, default=2)
+    parser.add_argument(
+        "--speed", type=float, default=4, help="run this many times faster"
+    )
+    args = parser.parse_args()
+    rng = random.Random(5)
+    turns = [
+        (rng.choice(ACKS), answer_sentences(rng, args.sentences))
+        for _ in range(args.turns)
+    ]
+    print(
+        f"{args.turns} turns of 1 acknowledgment + {args.sentences} sentences "
+        f"(times in real seconds, run {args.speed:g}x faster)"
+    )
+    stats, first_audio, requests = asyncio.run(run(args, turns, 0, None))
+    report("sequential", stats, first_audio, requests, args.turns, args.speed)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = AudioCache(directory=directory)
+        stats, first_audio, requests = asyncio.run(run(args, turns, args.ahead, cache))
+    report("pipelined", stats, first_audio, requests, args.turns, args.speed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark concurrent large uploads: event-loop lag and peak memory.
+
+Several uploads arrive at once as 64KB network chunks while a probe task
+measures how late the event loop wakes it (it asks for a 5ms sleep). Each
+mode runs in its own process so peak RSS is its own.
+
+- legacy: the transcription routes' old path. Starlette spools the multipart
+  file part (threaded writes once it passes 1MB), then the handler reads it
+  whole with `file.file.read()` and writes it with a blocking `open().write()`
+- streaming: Uploads.receive_upload over the same chunks, batched threaded
+  writes with the sha256 computed alongside, then `save()` moves the spooled
+  file into place
+
+Usage:
+    python tests/benchmarks/upload_benchmark.py [--uploads 4] [--size-mb 256]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from starlette.datastructures import UploadFile  # noqa: E402
+
+from agixt.Uploads import receive_upload  # noqa: E402
+
+NETWORK_CHUNK = 64 * 1024
+BLOCK = hashlib.sha256(b"upload").digest() * (NETWORK_CHUNK // 32)
+
+
+async def network(size):
+    sent = 0
+    while sent < size:
+        chunk = BLOCK[: min(NETWORK_CHUNK, size - sent)]
+        sent += len(chunk)
+        await asyncio.sleep(0)
+        yield chunk
+
+
+async def legacy(size, directory, index):
+    form_file = UploadFile(tempfile.SpooledTemporaryFile(max_size=1024 * 1024), size=0)
+    async for chunk in network(size):
+        await form_file.write(chunk)
+    await form_file.seek(0)
+    with open(os.path.join(directory, f"legacy-{index}.bin"), "wb") as f:
+        f.write(form_file.file.read())
+
+
+async def streaming(size, directory, index):
+    upload = await receive_upload(
+        network(size), max_bytes=size, spool_dir=os.path.join(directory, "spool")
+    )
+    await upload.save(os.path.join(directory, f"streaming-{index}.bin"))
+
+
+async def probe(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append((time.perf_counter() - started - 0.005) * 1000)
+
+
+async def run_mode(mode, uploads, size):
+    handler = legacy if mode == "legacy" else streaming
+    lags, stop = [], asyncio.Event()
+    with tempfile.TemporaryDirectory(dir=os.getcwd()) as directory:
+        prober = asyncio.ensure_future(probe(lags, stop))
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(handler(size, directory, index) for index in range(uploads))
+        )
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await prober
+    lags.sort()
+    return {
+        "seconds": elapsed,
+        "lag_p50": lags[len(lags) // 2],
+        "lag_p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+        "lag_max": lags[-1],
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--mode", choices=["legacy", "streaming"])
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args.mode, args.uploads, size))))
+        return
+    print(f"{args.uploads} concurrent uploads of {args.size_mb}MB")
+    for mode in ("legacy", "streaming"):
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--mode",
+                mode,
+                "--uploads",
+                str(args.uploads),
+                "--size-mb",
+                str(args.size_mb),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:<10} {result['seconds']:>5.1f}s | event-loop lag p50 "
+            f"{result['lag_p50']:>6.1f}ms p99 {result['lag_p99']:>7.1f}ms "
+            f"max {result['lag_max']:>7.1f}ms | peak RSS {result['peak_rss_mb']:>6.0f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Benchmark billing analytics: raw audit table aggregation against usage rollups.
+
+Fills a SQLite database with synthetic CompanyTokenUsage rows (one year of
+usage across companies, users and agents), then measures:
+
+- raw: the aggregation the admin analytics endpoints ran on every call, per
+  company over all time and over a 30 day range
+- backfill: rolling the whole table up with the resumable backfill
+- rollups: the same totals answered from usage_rollup, a ranked keyset page
+  of companies, and a 30 day per-user breakdown of one company
+- write path: the cost of record_usage per recorded request
+
+and checks that the rollup totals equal the raw aggregation.
+
+Usage:
+    python tests/benchmarks/usage_rollup_benchmark.py [--rows 20000000]
+        [--companies 500] [--users 20000] [--agents 2000] [--db PATH]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    create_engine,
+    func,
+)
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.BillingAnalytics import (  # noqa: E402
+    GRANULARITY_ALL,
+    SCOPE_COMPANY,
+    SCOPE_USER,
+    UsageModels,
+    UsageRollupService,
+    keyset_page,
+    raw_usage_totals,
+    record_usage,
+    usage_totals,
+)
+
+START = datetime(2024, 1, 1)
+DAYS = 365
+
+Base = declarative_base()
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+class CompanyTokenUsage(Base):
+    __tablename__ = "CompanyTokenUsage"
+    id = Column(Integer, primary_key=True)
+    company_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    timestamp = Column(DateTime, nullable=False)
+    agent_id = Column(String, nullable=True)
+    rolled_up = Column(Boolean, nullable=True, default=False)
+
+
+class UsageRollup(Base):
+    __tablename__ = "usage_rollup"
+    id = Column(String, primary_key=True, default=new_id)
+    granularity = Column(String, nullable=False)
+    scope = Column(String, nullable=False)
+    subject_id = Column(String, nullable=False)
+    company_id = Column(String, nullable=False, default="")
+    bucket_start = Column(DateTime, nullable=False)
+    input_tokens = Column(BigInteger, nullable=False, default=0)
+    output_tokens = Column(BigInteger, nullable=False, default=0)
+    total_tokens = Column(BigInteger, nullable=False, default=0)
+    usage_count = Column(BigInteger, nullable=False, default=0)
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "scope", "subject_id", "company_id", "bucket_start"
+        ),
+        Index("ix_usage_rollup_bucket", "granularity", "scope", "bucket_start"),
+        Index(
+            "ix_usage_rollup_company",
+            "granularity",
+            "scope",
+            "company_id",
+            "bucket_start",
+        ),
+    )
+
+
+def timed(label, fn, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<52} {best * 1000:>12,.1f} ms")
+    return result
+
+
+def populate(engine, args):
+    rng = random.Random(1)
+    # Heavy-tailed: a few companies and users do most of the usage
+    companies = [f"company-{i}" for i in range(args.companies)]
+    users = [
+        (f"user-{i}", companies[int(rng.paretovariate(1.2)) % args.companies])
+        for i in range(args.users)
+    ]
+    agents = [f"agent-{i}" for i in range(args.agents)]
+    seconds = DAYS * 86400
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode=OFF")
+        connection.exec_driver_sql("PRAGMA synchronous=OFF")
+    raw = engine.raw_connection()
+    cursor = raw.cursor()
+    batch = []
+    for number in range(args.rows):
+        user_id, company_id = users[int(rng.paretovariate(1.1)) % args.users]
+        input_tokens = rng.randrange(50, 4000)
+        output_tokens = rng.randrange(10, 1500)
+        timestamp = START + timedelta(seconds=rng.randrange(seconds))
+        batch.append(
+            (
+                company_id,
+                user_id,
+                input_tokens,
+                output_tokens,
+                input_tokens + output_tokens,
+                timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                agents[rng.randrange(args.agents)] if rng.random() < 0.8 else None,
+            )
+        )
+        if len(batch) == 100_000:
+            cursor.executemany(
+                'INSERT INTO "CompanyTokenUsage" (company_id, user_id, '
+                "input_tokens, output_tokens, total_tokens, timestamp, agent_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            raw.commit()
+            batch = []
+            if (number + 1) % 2_000_000 == 0:
+                print(f"  {number + 1:,} rows", flush=True)
+    if batch:
+        cursor.executemany(
+            'INSERT INTO "CompanyTokenUsage" (company_id, user_id, '
+            "input_tokens, output_tokens, total_tokens, timestamp, agent_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+        raw.commit()
+    raw.close()
+    with engine.begin() as connection:
+        # The migration's index over rows still to roll up
+        connection.exec_driver_sql(
+            "CREATE INDEX ix_company_token_usage_pending "
+            'ON "CompanyTokenUsage" (timestamp, id) WHERE rolled_up IS NOT 1'
+        )
+        connection.exec_driver_sql(
+            "CREATE INDEX ix_company_token_usage_company_ts "
+            'ON "CompanyTokenUsage" (company_id, timestamp)'
+        )
+    print(f"populated {args.rows:,} usage rows in {time.perf_counter() - started:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20_000_000)
+    parser.add_argument("--companies", type=int, default=500)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--agents", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--db", default=None, help="reuse or keep this database")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "usage.db")
+    engine = create_engine(f"sqlite:///{path}")
+    fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+    Base.metadata.create_all(engine)
+    if fresh:
+        populate(engine, args)
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    rows = session.query(func.count(CompanyTokenUsage.id)).scalar()
+    print(f"{rows:,} usage rows in {path}")
+
+    range_end = START + timedelta(days=DAYS - 1)
+    range_start = range_end - timedelta(days=30)
+
+    print("\nraw audit table (as the analytics endpoints queried it)")
+    raw_all = timed(
+        "per-company totals, all time",
+        lambda: raw_usage_totals(session, CompanyTokenUsage, SCOPE_COMPANY),
+    )
+    raw_range = timed(
+        "per-company totals, last 30 days",
+        lambda: raw_usage_totals(
+            session, CompanyTokenUsage, SCOPE_COMPANY, range_start, range_end
+        ),
+    )
+
+    print("\nbackfill")
+    service = UsageRollupService(
+        session_factory=factory,
+        models=UsageModels(usage=CompanyTokenUsage, rollup=UsageRollup),
+        batch_size=args.batch_size,
+    )
+    started = time.perf_counter()
+    processed = service.backfill()
+    elapsed = time.perf_counter() - started
+    rollups = session.query(func.count(UsageRollup.id)).scalar()
+    print(
+        f"rolled up {processed:,} rows into {rollups:,} rollup rows in "
+        f"{elapsed:.0f}s ({processed / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
+
+    print("\nrollups")
+    rolled_all = timed(
+        "per-company totals, all time",
+        lambda: usage_totals(session, UsageRollup, SCOPE_COMPANY),
+        repeat=3,
+    )
+    rolled_range = timed(
+        "per-company totals, last 30 days",
+        lambda: usage_totals(
+            session, UsageRollup, SCOPE_COMPANY, range_start, range_end
+        ),
+        repeat=3,
+    )
+    query = session.query(UsageRollup.subject_id, UsageRollup.total_tokens).filter(
+        UsageRollup.granularity == GRANULARITY_ALL,
+        UsageRollup.scope == SCOPE_COMPANY,
+    )
+    columns = [UsageRollup.total_tokens, UsageRollup.subject_id]
+    page, cursor = timed(
+        "ranked company page (100), first",
+        lambda: keyset_page(
+            query, columns, None, 100, True, key=lambda r: (r[1], r[0])
+        ),
+        repeat=3,
+    )
+    timed(
+        "ranked company page (100), next by cursor",
+        lambda: keyset_page(
+            query, columns, cursor, 100, True, key=lambda r: (r[1], r[0])
+        ),
+        repeat=3,
+    )
+    top_company = page[0][0]
+    timed(
+        "per-user breakdown of the top company, 30 days",
+        lambda: usage_totals(
+            session,
+            UsageRollup,
+            SCOPE_USER,
+            range_start,
+            range_end,
+            company_id=top_company,
+        ),
+        repeat=3,
+    )
+
+    assert rolled_all == raw_all, "all-time totals differ from the raw table"
+    assert rolled_range == raw_range, "range totals differ from the raw table"
+    print("\nparity: rollup totals equal the raw aggregation")
+
+    print("\nwrite path")
+    requests = 2000
+    timestamp = range_end
+    started = time.perf_counter()
+    for number in range(requests):
+        record_usage(
+            session,
+            UsageRollup,
+            f"company-{number % args.companies}",
+            f"user-{number % args.users}",
+            f"agent-{number % args.agents}",
+            1200,
+            300,
+            timestamp,
+        )
+        session.commit()
+    elapsed = time.perf_counter() - started
+    print(f"record_usage + commit: {elapsed / requests * 1000:.2f} ms per request")
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
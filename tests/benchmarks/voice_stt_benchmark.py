@@ -0,0 +1,305 @@
+"""
+Benchmark voice turns: end of speech to first reply audio, with the whole
+utterance transcribed after it ends against streaming transcription.
+
+Synthesizes PCM recordings of utterances (voiced words separated by short
+gaps, with background noise) and plays them in real time, scaled by --speed,
+through the same endpointer in every mode. Transcription, triage and TTS
+are fakes with latencies set on the command line; the fake recognizer
+returns one word of the script per voiced run it hears.
+
+- batch: the session's old path. The complete utterance is posted for
+  transcription once speech ends, then the speaker triages it (category,
+  then acknowledgment) and the first audio is spoken
+- streaming (batch fallback): StreamingTranscriber over the batch endpoint;
+  partials while speaking, the pause partial reused as the final transcript,
+  and triage prefetched from stable partials
+- streaming (provider): the same with a provider that streams hypotheses
+
+Reports end-of-speech to first-audio latency per mode, STT requests per
+utterance, and how often the prefetched triage matched the final transcript.
+
+Usage:
+    python tests/benchmarks/voice_stt_benchmark.py [--utterances 8]
+        [--stt-base 0.25] [--stt-per-second 0.15] [--triage 0.25]
+        [--ack 0.35] [--tts-first-audio 0.2] [--speed 4]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+import wave
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+for path in (PROJECT_ROOT, AGIXT_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from agixt.SpeechStream import (  # noqa: E402
+    EnergyEndpointer,
+    SpeculativeTurn,
+    STTProvider,
+    STTStream,
+    StreamingTranscriber,
+    frame_energy,
+)
+
+RATE = 16000
+FRAME = RATE * 20 // 1000 * 2
+SENTENCES = [
+    "what is the weather like today",
+    "turn on the living room lights",
+    "remind me to call the dentist tomorrow morning at nine",
+    "how many meetings do I have this afternoon",
+    "play some quiet music",
+    "summarize the last email from my manager and draft a short reply",
+    "what time is it",
+    "add milk eggs and bread to the shopping list",
+]
+
+
+def utterance_pcm(words, rng):
+    """One utterance: voiced words with short gaps, noise before and after."""
+
+    def noise(seconds):
+        return rng.normal(0, 60, int(RATE * seconds))
+
+    parts = [noise(0.4)]
+    for index, _ in enumerate(words):
+        if index:
+            parts.append(noise(rng.uniform(0.08, 0.14)))
+        t = np.arange(int(RATE * rng.uniform(0.18, 0.32))) / RATE
+        pitch = rng.uniform(110, 220)
+        voiced = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 5))
+        envelope = np.minimum(1, np.minimum(t, t[-1] - t) / 0.02)
+        parts.append(4000 * voiced * envelope + rng.normal(0, 60, t.size))
+    parts.append(noise(1.0))
+    return np.clip(np.concatenate(parts), -32768, 32767).astype("<i2").tobytes()
+
+
+def recognize(pcm, words):
+    runs, voiced, gap = 0, False, 0
+    for start in range(0, len(pcm) - FRAME + 1, FRAME):
+        if frame_energy(pcm[start : start + FRAME]) >= 500:
+            runs += 0 if voiced else 1
+            voiced, gap = True, 0
+        else:
+            gap += 1
+            voiced = voiced and gap < 2
+    return " ".join(words[:runs])
+
+
+class FakeBatchSTT(STTProvider):
+    def __init__(self, args):
+        self.args = args
+        self.words = []
+        self.requests = 0
+
+    async def transcribe(self, audio, filename="audio.wav", content_type="audio/wav"):
+        self.requests += 1
+        with wave.open(io.BytesIO(audio)) as wav:
+            pcm = wav.readframes(wav.getnframes())
+        seconds = len(pcm) / 2 / RATE
+        await asyncio.sleep(
+            (self.args.stt_base + self.args.stt_per_second * seconds) / self.args.speed
+        )
+        return recognize(pcm, self.words)
+
+
+class FakeStreamingSTT(FakeBatchSTT):
+    streaming = True
+
+    def open_stream(self, sample_rate, on_partial=None):
+        return FakeStream(self, sample_rate, on_partial)
+
+
+class FakeStream(STTStream):
+    """Hypothesis every 100ms; the final needs one short model step."""
+
+    def __init__(self, provider, sample_rate, on_partial):
+        super().__init__(sample_rate, on_partial)
+        self.provider = provider
+        self.audio = bytearray()
+
+    async def send(self, pcm, voiced=True):
+        before = len(self.audio) // 3200
+        self.audio.extend(pcm)
+        if len(self.audio) // 3200 > before:
+            await self._report(recognize(bytes(self.audio), self.provider.words))
+
+    async def finish(self):
+        self.provider.requests += 1
+        await asyncio.sleep(self.provider.args.stt_base / 4 / self.provider.args.speed)
+        return recognize(bytes(self.audio), self.provider.words)
+
+
+class FakeSpeaker:
+    """Triage, acknowledgment and TTS with fixed latencies."""
+
+    def __init__(self, args):
+        self.args = args
+
+    async def triage(self, text):
+        await asyncio.sleep(self.args.triage / self.args.speed)
+        return "THINKER"
+
+    async def acknowledge(self, text, category):
+        await category
+        await asyncio.sleep(self.args.ack / self.args.speed)
+        return f"Sure, {text[:20]}"
+
+    async def first_audio(self, text):
+        await asyncio.sleep(self.args.tts_first_audio / self.args.speed)
+
+
+async def play(pcm, speed, feed):
+    """Deliver PCM in 20ms frames at real time x speed."""
+    started = time.perf_counter()
+    for index, start in enumerate(range(0, len(pcm), FRAME)):
+        delay = started + (index * 0.02) / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await feed(pcm[start : start + FRAME])
+
+
+async def turn(speaker, text, prefetched=None):
+    """The session's speaker path up to the first audio of the acknowledgment."""
+    prefetched = prefetched or {}
+    category = prefetched.get("category") or asyncio.ensure_future(speaker.triage(text))
+    await category
+    followup = prefetched.get("followup") or asyncio.ensure_future(
+        speaker.acknowledge(text, category)
+    )
+    await speaker.first_audio(await followup)
+
+
+async def run_batch(args, utterances):
+    speaker = FakeSpeaker(args)
+    provider = FakeBatchSTT(args)
+    latencies = []
+
+    async def respond(audio, ended):
+        wav = io.BytesIO()
+        with wave.open(wav, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(RATE)
+            out.writeframes(audio)
+        text = await provider.transcribe(wav.getvalue())
+        await turn(speaker, text)
+        latencies.append((time.perf_counter() - ended) * args.speed)
+
+    for words, pcm in utterances:
+        provider.words = words
+        endpointer = EnergyEndpointer(sample_rate=RATE)
+        buffer = bytearray()
+        turns = []
+
+        async def feed(frame):
+            for event in endpointer.feed(frame):
+                if event.kind in ("start", "audio"):
+                    buffer.extend(event.audio)
+                elif event.kind == "end":
+                    turns.append(
+                        asyncio.ensure_future(
+                            respond(bytes(buffer), time.perf_counter())
+                        )
+                    )
+
+        await play(pcm, args.speed, feed)
+        await asyncio.gather(*turns)
+    return latencies, provider.requests, None
+
+
+async def run_streaming(args, utterances, provider):
+    speaker = FakeSpeaker(args)
+    speculation = SpeculativeTurn()
+    latencies = []
+    finals = []
+
+    def prefetch(text):
+        category = asyncio.ensure_future(speaker.triage(text))
+        return {
+            "category": category,
+            "followup": asyncio.ensure_future(speaker.acknowledge(text, category)),
+        }
+
+    async def on_partial(text, stable):
+        if stable:
+            speculation.start(text, prefetch)
+
+    async def on_final(text, speech_ended_at):
+        await turn(speaker, text, speculation.take(text))
+        finals.append(text)
+        latencies.append((time.monotonic() - speech_ended_at) * args.speed)
+
+    for words, pcm in utterances:
+        provider.words = words
+        transcriber = StreamingTranscriber(
+            provider, on_partial=on_partial, on_final=on_final, sample_rate=RATE
+        )
+        await play(pcm, args.speed, transcriber.feed)
+        await transcriber.join()
+    assert finals == [" ".join(words) for words, _ in utterances], finals
+    return latencies, provider.requests, speculation.get_stats()
+
+
+def report(label, latencies, requests, count, speculation):
+    latencies = sorted(latencies)
+    p90 = latencies[max(0, int(len(latencies) * 0.9) - 1)]
+    line = (
+        f"{label:<28} first audio p50 {statistics.median(latencies) * 1000:>6.0f}ms "
+        f"p90 {p90 * 1000:>6.0f}ms | STT requests/utterance {requests / count:>5.2f}"
+    )
+    if speculation:
+        line += f" | prefetch hits {speculation['hits']}/{count}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--utterances", type=int, default=8)
+    parser.add_argument("--stt-base", type=float, default=0.25)
+    parser.add_argument(
+        "--stt-per-second",
+        type=float,
+        default=0.15,
+        help="transcription seconds per second of audio",
+    )
+    parser.add_argument("--triage", type=float, default=0.25)
+    parser.add_argument("--ack", type=float, default=0.35)
+    parser.add_argument("--tts-first-audio", type=float, default=0.2)
+    parser.add_argument(
+        "--speed", type=float, default=4, help="play audio this many times faster"
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(11)
+    sentences = [SENTENCES[i % len(SENTENCES)] for i in range(args.utterances)]
+    utterances = [(s.split(), utterance_pcm(s.split(), rng)) for s in sentences]
+    seconds = sum(len(pcm) for _, pcm in utterances) / 2 / RATE
+    print(
+        f"{len(utterances)} utterances, {seconds:.1f}s of audio "
+        f"(times in audio seconds, played {args.speed:g}x faster)"
+    )
+    count = len(utterances)
+    latencies, requests, _ = asyncio.run(run_batch(args, utterances))
+    report("batch after end of speech", latencies, requests, count, None)
+    latencies, requests, speculation = asyncio.run(
+        run_streaming(args, utterances, FakeBatchSTT(args))
+    )
+    report("streaming (batch fallback)", latencies, requests, count, speculation)
+    latencies, requests, speculation = asyncio.run(
+        run_streaming(args, utterances, FakeStreamingSTT(args))
+    )
+    report("streaming (provider)", latencies, requests, count, speculation)
+
+
+if __name__ == "__main__":
+    main()
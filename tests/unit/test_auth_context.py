@@ -0,0 +1,183 @@
+import os
+import sys
+import uuid
+from datetime import datetime
+
+import jwt
+import pytest
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.testclient import TestClient
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt import AuthContext as auth_module  # noqa: E402
+from agixt.AuthContext import (  # noqa: E402
+    SOURCE_JWT,
+    SOURCE_PAT,
+    AuthContext,
+    AuthContextResolver,
+    RevocationList,
+    get_auth_context,
+    token_digest,
+)
+
+SECRET = "unit-test-secret-that-is-long-enough-for-hs256"
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def delete_pattern(self, pattern):
+        prefix, _, suffix = pattern.partition("*")
+        for key in [k for k in self.values if k.startswith(prefix)]:
+            if key.endswith(suffix.split("*")[-1]):
+                del self.values[key]
+
+
+class CountingLoader:
+    def __init__(self, scopes=("agents:read",), super_admin=False):
+        self.calls = 0
+        self.scopes = set(scopes)
+        self.super_admin = super_admin
+
+    def __call__(self, token, source, identity):
+        self.calls += 1
+        return AuthContext(
+            token=token,
+            source=source,
+            user={"id": identity["user_id"], "email": identity["email"]},
+            user_id=identity["user_id"],
+            email=identity["email"],
+            company_id="company-1",
+            is_super_admin=self.super_admin,
+            scopes=set(self.scopes),
+        )
+
+
+def make_token(user_id="user-1", email="a@example.com"):
+    return jwt.encode({"sub": user_id, "email": email}, SECRET, algorithm="HS256")
+
+
+def make_resolver(revoked=(), **loader_kwargs):
+    cache = LocalCache()
+    loads = []
+
+    def load_revoked():
+        loads.append(1)
+        return [token_digest(token) for token in revoked]
+
+    resolver = AuthContextResolver(
+        cache=cache,
+        revocations=RevocationList(cache=cache, load=load_revoked),
+        load_context=CountingLoader(**loader_kwargs),
+        secret=SECRET,
+    )
+    return resolver, loads
+
+
+def test_context_is_loaded_once_and_revocations_come_from_the_cached_set():
+    token = make_token()
+    resolver, revoked_loads = make_resolver()
+    context = resolver.resolve(f"Bearer {token}")
+    assert context.source == SOURCE_JWT and context.user_id == "user-1"
+    assert context.has_scope("agents:read") and not context.has_scope("agents:write")
+    for _ in range(5):
+        assert resolver.resolve(token).email == "a@example.com"
+    assert resolver.load_context.calls == 1
+    assert len(revoked_loads) == 1
+    # Answered from the caches alone, as get_auth_context does on the event loop
+    assert resolver.resolve_cached(token).company_id == "company-1"
+
+    resolver.revoke(token)
+    with pytest.raises(HTTPException) as error:
+        resolver.resolve(token)
+    assert error.value.status_code == 401 and "revoked" in error.value.detail
+    with pytest.raises(HTTPException):
+        resolver.resolve_cached(token)
+    with pytest.raises(HTTPException):
+        resolver.resolve("not-a-jwt")
+
+    # Another worker starts from the set stored in the shared cache
+    other, other_loads = make_resolver(revoked=[token])
+    with pytest.raises(HTTPException):
+        other.resolve(token)
+    assert other.resolve(make_token("user-2")).user_id == "user-2"
+    assert len(other_loads) == 1
+
+
+def test_scope_rules_and_cache_round_trip():
+    context = AuthContext(
+        token="t",
+        source=SOURCE_JWT,
+        user={"id": uuid.UUID(int=1), "created_at": datetime(2024, 1, 2, 3, 4)},
+        user_id="user-1",
+        scopes={"ext:github:*", "chains:*"},
+    )
+    assert context.has_all_scopes(["ext:github:issues:read", "chains:write"])
+    assert not context.has_any_scope(["agents:read", "ext:slack:send"])
+    restored = AuthContext.from_cache("t", context.to_cache())
+    assert restored.scopes == context.scopes
+    assert restored.user["created_at"] == datetime(2024, 1, 2, 3, 4)
+    assert restored.user["id"] == str(uuid.UUID(int=1))
+
+    # Personal access tokens are limited to their own scopes, even for admins
+    pat = AuthContext(
+        token="agixt_x",
+        source=SOURCE_PAT,
+        user={"id": "user-1"},
+        user_id="user-1",
+        is_super_admin=True,
+        pat_scopes={"agents:read"},
+        pat_agent_ids={"agent-1"},
+    )
+    assert pat.has_scope("agents:read") and not pat.has_scope("agents:write")
+    assert pat.user_dict()["_pat_agent_ids"] == ["agent-1"]
+    admin = AuthContext(token="t", source=SOURCE_JWT, user={}, user_id="u")
+    admin.is_super_admin = True
+    assert admin.has_scope("anything:at_all")
+
+
+def test_dependencies_share_one_resolution_per_request(monkeypatch):
+    resolver, _ = make_resolver()
+    monkeypatch.setattr(auth_module, "auth_context_resolver", resolver)
+    app = FastAPI()
+
+    async def require_agents_read(request: Request, authorization: str = Header(None)):
+        context = await get_auth_context(request, authorization)
+        if not context.has_scope("agents:read"):
+            raise HTTPException(status_code=403)
+
+    @app.get("/agents", dependencies=[Depends(require_agents_read)])
+    async def agents(
+        request: Request, context: AuthContext = Depends(get_auth_context)
+    ):
+        return {
+            "user": context.user_id,
+            "same": request.state.auth_context is context,
+        }
+
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {make_token()}"}
+    for _ in range(3):
+        response = client.get("/agents", headers=headers)
+        assert response.json() == {"user": "user-1", "same": True}
+    assert resolver.load_context.calls == 1
+    # One resolution per request; the first in the threadpool, then cached
+    assert resolver.stats["resolves"] == 3
+    assert resolver.stats["event_loop_resolves"] == 2
+    assert client.get("/agents").status_code == 401
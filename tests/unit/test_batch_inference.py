@@ -0,0 +1,214 @@
+import asyncio
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.BatchInference import BatchJobManager, run_batch  # noqa: E402
+
+LATENCY = 0.05
+
+
+class FakeProvider:
+    """Fixed-latency provider that can be told to fail or hang on some prompts"""
+
+    def __init__(self, latency=LATENCY, supports_batching=False):
+        self.latency = latency
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+        self.batch_calls = 0
+        self.attempts = {}
+        self.flaky = set()
+        self.hanging = set()
+        self.broken = set()
+        self.supports_batching = supports_batching
+
+    async def inference(self, prompt):
+        self.calls += 1
+        self.attempts[prompt] = self.attempts.get(prompt, 0) + 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            if prompt in self.hanging:
+                await asyncio.sleep(60)
+            await asyncio.sleep(self.latency)
+            if prompt in self.broken:
+                raise RuntimeError(f"provider rejected {prompt}")
+            if prompt in self.flaky and self.attempts[prompt] == 1:
+                raise ConnectionError("connection reset")
+            return prompt.upper()
+        finally:
+            self.active -= 1
+
+    async def batch_inference(self, prompts):
+        if not self.supports_batching:
+            return None
+        self.batch_calls += 1
+        await asyncio.sleep(self.latency)
+        return [prompt.upper() for prompt in prompts]
+
+
+class BillingError(Exception):
+    status_code = 402
+
+
+class LocalCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, ttl=0):
+        self.data[key] = value
+        return True
+
+    def exists(self, key):
+        return key in self.data
+
+    def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+
+def test_results_are_ordered_with_per_item_errors():
+    provider = FakeProvider()
+    provider.broken.add("p3")
+    inputs = [f"p{i}" for i in range(8)]
+
+    results = asyncio.run(run_batch(inputs, provider.inference, concurrency=4))
+
+    assert [r.index for r in results] == list(range(8))
+    assert [r.output for r in results if r.ok] == [f"P{i}" for i in range(8) if i != 3]
+    assert results[3].error == "provider rejected p3"
+    assert results[3].output is None
+
+
+def test_concurrency_limit_and_throughput():
+    provider = FakeProvider()
+    inputs = [f"p{i}" for i in range(40)]
+
+    start = time.perf_counter()
+    results = asyncio.run(run_batch(inputs, provider.inference, concurrency=8))
+    elapsed = time.perf_counter() - start
+
+    assert all(r.ok for r in results)
+    assert provider.peak == 8
+    # Sequential would take 40 * LATENCY; 8 wide needs about 5 rounds
+    assert elapsed < 40 * LATENCY / 4
+    print(
+        f"\n40 items at concurrency 8: {elapsed * 1000:.0f} ms "
+        f"({len(inputs) / elapsed:.0f} items/s, sequential "
+        f"{40 * LATENCY * 1000:.0f} ms)"
+    )
+
+
+def test_timeouts_and_retries():
+    provider = FakeProvider()
+    provider.flaky.add("flaky")
+    provider.hanging.add("hangs")
+    provider.broken.add("broken")
+
+    results = asyncio.run(
+        run_batch(
+            ["flaky", "hangs", "fine", "broken"],
+            provider.inference,
+            concurrency=4,
+            timeout=0.3,
+            retries=1,
+            retry_backoff=0.01,
+        )
+    )
+    flaky, hangs, fine, broken = results
+    assert flaky.ok and flaky.output == "FLAKY" and flaky.attempts == 2
+    assert hangs.error == "Timed out after 0.3s" and hangs.attempts == 2
+    assert fine.attempts == 1
+    assert broken.attempts == 2 and not broken.ok
+
+
+def test_client_errors_are_not_retried():
+    async def worker(prompt):
+        raise BillingError("Insufficient balance")
+
+    results = asyncio.run(run_batch(["a"], worker, retries=3, retry_backoff=0.01))
+    assert results[0].attempts == 1
+    assert results[0].error == "Insufficient balance"
+
+
+def test_provider_batching_groups_items():
+    provider = FakeProvider(supports_batching=True)
+    inputs = [f"p{i}" for i in range(50)]
+
+    results = asyncio.run(
+        run_batch(
+            inputs,
+            provider.inference,
+            batch_worker=provider.batch_inference,
+            provider_batch_size=16,
+        )
+    )
+    assert [r.output for r in results] == [f"P{i}" for i in range(50)]
+    assert provider.batch_calls == 4
+    assert provider.calls == 0
+
+
+def test_provider_without_batching_falls_back_to_single_requests():
+    provider = FakeProvider(supports_batching=False)
+    results = asyncio.run(
+        run_batch(
+            ["a", "b", "c"],
+            provider.inference,
+            batch_worker=provider.batch_inference,
+        )
+    )
+    assert [r.output for r in results] == ["A", "B", "C"]
+    assert provider.calls == 3
+
+
+def test_batch_job_lifecycle_and_cancellation():
+    cache = LocalCache()
+    manager = BatchJobManager(cache=cache)
+    provider = FakeProvider()
+
+    async def scenario():
+        job = manager.submit(
+            user_id="user-1",
+            inputs=[f"p{i}" for i in range(6)],
+            worker=provider.inference,
+            concurrency=3,
+        )
+        assert job["status"] == "queued" and "results" not in job
+        await manager.wait(job["id"])
+        finished = manager.get(job["id"], user_id="user-1")
+        assert finished["status"] == "completed"
+        assert finished["completed"] == 6 and finished["failed"] == 0
+        assert [r["output"] for r in finished["results"]] == [f"P{i}" for i in range(6)]
+        # Other users cannot see the job
+        assert manager.get(job["id"], user_id="user-2") is None
+
+        slow = FakeProvider(latency=0.2)
+        job = manager.submit(
+            user_id="user-1",
+            inputs=[f"s{i}" for i in range(10)],
+            worker=slow.inference,
+            concurrency=2,
+        )
+        await asyncio.sleep(0.3)
+        assert manager.get(job["id"], "user-1")["status"] == "running"
+        assert manager.cancel(job["id"], user_id="user-1")
+        await manager.wait(job["id"])
+        cancelled = manager.get(job["id"], user_id="user-1")
+        assert cancelled["status"] == "cancelled"
+        errors = [r["error"] for r in cancelled["results"]]
+        assert errors.count(None) >= 2
+        assert "Cancelled" in errors
+        assert slow.calls < 10
+        assert not manager.cancel(job["id"], user_id="user-1")
+
+    asyncio.run(scenario())
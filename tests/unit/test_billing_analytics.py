@@ -0,0 +1,276 @@
+import csv
+import io
+import json
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Integer,
+    String,
+    UniqueConstraint,
+    create_engine,
+)
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.BillingAnalytics import (  # noqa: E402
+    GRANULARITY_ALL,
+    GRANULARITY_DAY,
+    SCOPE_AGENT,
+    SCOPE_COMPANY,
+    SCOPE_USER,
+    SCOPES,
+    UsageModels,
+    UsageRollupService,
+    backfill_batch,
+    iter_csv,
+    iter_json_document,
+    keyset_page,
+    pending_rows,
+    raw_usage_totals,
+    record_usage,
+    rollup_rows,
+    usage_totals,
+)
+
+START = datetime(2024, 3, 1)
+
+Base = declarative_base()
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+class CompanyTokenUsage(Base):
+    __tablename__ = "CompanyTokenUsage"
+    id = Column(String, primary_key=True, default=new_id)
+    company_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    timestamp = Column(DateTime, nullable=False)
+    agent_id = Column(String, nullable=True)
+    rolled_up = Column(Boolean, nullable=True, default=False)
+
+
+class UsageRollup(Base):
+    __tablename__ = "usage_rollup"
+    id = Column(String, primary_key=True, default=new_id)
+    granularity = Column(String, nullable=False)
+    scope = Column(String, nullable=False)
+    subject_id = Column(String, nullable=False)
+    company_id = Column(String, nullable=False, default="")
+    bucket_start = Column(DateTime, nullable=False)
+    input_tokens = Column(BigInteger, nullable=False, default=0)
+    output_tokens = Column(BigInteger, nullable=False, default=0)
+    total_tokens = Column(BigInteger, nullable=False, default=0)
+    usage_count = Column(BigInteger, nullable=False, default=0)
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "scope", "subject_id", "company_id", "bucket_start"
+        ),
+    )
+
+
+class UserPreferences(Base):
+    __tablename__ = "user_preferences"
+    id = Column(String, primary_key=True, default=new_id)
+    user_id = Column(String, nullable=False)
+    pref_key = Column(String, nullable=False)
+    pref_value = Column(String, nullable=True)
+
+
+class UserCompany(Base):
+    __tablename__ = "UserCompany"
+    id = Column(String, primary_key=True, default=new_id)
+    user_id = Column(String, nullable=False)
+    company_id = Column(String, nullable=False)
+
+
+MODELS = UsageModels(
+    usage=CompanyTokenUsage,
+    rollup=UsageRollup,
+    preferences=UserPreferences,
+    user_company=UserCompany,
+)
+
+
+def make_session_factory():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def add_raw_usage(session, rows=600, seed=7, rolled_up=None):
+    rng = random.Random(seed)
+    for _ in range(rows):
+        company = f"company-{rng.randrange(3)}"
+        input_tokens, output_tokens = rng.randrange(500), rng.randrange(200)
+        session.add(
+            CompanyTokenUsage(
+                company_id=company,
+                user_id=f"user-{rng.randrange(6)}",
+                agent_id=rng.choice([None, "agent-a", "agent-b"]),
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                total_tokens=input_tokens + output_tokens,
+                timestamp=START + timedelta(minutes=rng.randrange(10 * 24 * 60)),
+                rolled_up=rolled_up,
+            )
+        )
+    session.commit()
+
+
+RANGES = [
+    (None, None),
+    (START + timedelta(hours=5, minutes=20), START + timedelta(days=4, hours=7)),
+    (START + timedelta(days=2, hours=3), START + timedelta(days=2, hours=9)),
+    (START + timedelta(days=3), None),
+    (None, START + timedelta(days=6, hours=23, minutes=59)),
+]
+
+
+def assert_parity(session):
+    for scope in SCOPES:
+        for start, end in RANGES:
+            expected = raw_usage_totals(session, CompanyTokenUsage, scope, start, end)
+            assert expected, (scope, start, end)
+            assert usage_totals(session, UsageRollup, scope, start, end) == expected
+
+
+def test_resumable_backfill_matches_the_raw_table():
+    factory = make_session_factory()
+    session = factory()
+    add_raw_usage(session)
+    assert pending_rows(session, CompanyTokenUsage) == 600
+
+    # Stopped after two batches, then resumed by another worker
+    first = UsageRollupService(session_factory=factory, models=MODELS, batch_size=100)
+    assert first.backfill(max_batches=2) == 200
+    assert pending_rows(session, CompanyTokenUsage) == 400
+    second = UsageRollupService(session_factory=factory, models=MODELS, batch_size=250)
+    assert second.backfill() == 400
+    assert second.backfill() == 0
+    assert_parity(session)
+
+    # New usage goes through the write path and is already rolled up
+    timestamp = START + timedelta(days=2, hours=4, minutes=30)
+    assert record_usage(
+        session, UsageRollup, "company-1", "user-2", "agent-a", 40, 2, timestamp
+    )
+    session.add(
+        CompanyTokenUsage(
+            company_id="company-1",
+            user_id="user-2",
+            agent_id="agent-a",
+            input_tokens=40,
+            output_tokens=2,
+            total_tokens=42,
+            timestamp=timestamp,
+            rolled_up=True,
+        )
+    )
+    session.commit()
+    assert backfill_batch(session, MODELS) == 0
+    assert_parity(session)
+    session.close()
+
+
+def test_preference_totals_are_seeded_once():
+    factory = make_session_factory()
+    session = factory()
+    add_raw_usage(session, rows=50)
+    session.add_all(
+        [
+            UserCompany(user_id="user-9", company_id="company-2"),
+            # Usage from before audit rows existed
+            UserPreferences(
+                user_id="user-9", pref_key="input_tokens", pref_value="700"
+            ),
+            UserPreferences(
+                user_id="user-9", pref_key="output_tokens", pref_value="30"
+            ),
+        ]
+    )
+    session.commit()
+    service = UsageRollupService(session_factory=factory, models=MODELS)
+    service.backfill()
+    lifetime = usage_totals(session, UsageRollup, SCOPE_USER)
+    assert lifetime["user-9"]["total_tokens"] == 730
+    assert lifetime["user-9"]["usage_count"] == 0
+    company = usage_totals(session, UsageRollup, SCOPE_COMPANY)["company-2"]
+    service.backfill()
+    assert usage_totals(session, UsageRollup, SCOPE_COMPANY)["company-2"] == company
+    assert service.get_stats(session)["baseline_seeded"]
+    # Ranges only contain usage with a timestamp
+    assert "user-9" not in usage_totals(
+        session, UsageRollup, SCOPE_USER, START, START + timedelta(days=30)
+    )
+    session.close()
+
+
+def test_keyset_pages_and_streamed_exports():
+    factory = make_session_factory()
+    session = factory()
+    add_raw_usage(session, rows=300, seed=3)
+    UsageRollupService(session_factory=factory, models=MODELS).backfill()
+
+    query = session.query(UsageRollup).filter(
+        UsageRollup.granularity == GRANULARITY_ALL, UsageRollup.scope == SCOPE_USER
+    )
+    columns = [UsageRollup.total_tokens, UsageRollup.subject_id, UsageRollup.company_id]
+
+    def key(row):
+        return (row.total_tokens, row.subject_id, row.company_id)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = keyset_page(query, columns, cursor, 4, True, key=key)
+        seen.extend(key(row) for row in page)
+        if cursor is None:
+            break
+    assert seen == sorted((key(row) for row in query), reverse=True)
+    assert len(seen) == len(set(seen))
+    with pytest.raises(ValueError):
+        keyset_page(query, columns, "not a cursor", 4, True, key=key)
+
+    daily = list(
+        rollup_rows(session, UsageRollup, GRANULARITY_DAY, SCOPE_AGENT, batch_size=7)
+    )
+    assert (
+        len(daily)
+        == session.query(UsageRollup)
+        .filter_by(granularity=GRANULARITY_DAY, scope=SCOPE_AGENT)
+        .count()
+    )
+    assert [row["bucket_start"] for row in daily] == sorted(
+        row["bucket_start"] for row in daily
+    )
+    columns = list(daily[0])
+    parsed = list(csv.DictReader(io.StringIO("".join(iter_csv(columns, daily, 5)))))
+    assert len(parsed) == len(daily)
+    assert int(parsed[3]["total_tokens"]) == daily[3]["total_tokens"]
+    document = json.loads("".join(iter_json_document(columns, iter(daily))))
+    assert document["total_rows"] == len(daily) and document["rows"] == daily
+    session.close()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.BotPipeline import (  # noqa: E402
+    ConversationPipeline,
+    InboundMessage,
+    LookupCache,
+    StreamingReply,
+    iter_stream_content,
+    split_message,
+)
+from agixt.BotRuntime import CompanyInbox  # noqa: E402
+
+
+def message(text, conversation="chat-1", message_id=None):
+    return InboundMessage(
+        platform="test",
+        company_id="company",
+        conversation_key=conversation,
+        user_id="user",
+        text=text,
+        message_id=message_id or "",
+        is_command=text.startswith("/"),
+    )
+
+
+def test_bursts_become_one_ordered_turn_per_conversation():
+    async def scenario():
+        turns = []
+        running = {}
+
+        async def handler(turn):
+            key = turn.conversation_key
+            assert not running.get(key), "two turns in flight for one conversation"
+            running[key] = True
+            await asyncio.sleep(0.05)
+            turns.append((key, turn.text, turn.batch_size))
+            running[key] = False
+
+        inbox = CompanyInbox("company", maxsize=10, concurrency=4)
+        pipeline = ConversationPipeline(
+            handler, inbox=inbox, debounce=0.03, max_wait=0.5
+        )
+        for text in ["hi", "one more thing", "and this"]:
+            pipeline.submit(message(text))
+            await asyncio.sleep(0.01)
+        pipeline.submit(message("other chat", conversation="chat-2"))
+        # The same event delivered twice is only handled once
+        pipeline.submit(message("/help", message_id="7"))
+        pipeline.submit(message("/help", message_id="7"))
+        await asyncio.sleep(0.02)
+        # Arrives while the first turn runs; becomes the next turn
+        pipeline.submit(message("after"))
+        while pipeline.get_stats()["conversations"]:
+            await asyncio.sleep(0.01)
+
+        chat_1 = [(text, size) for key, text, size in turns if key == "chat-1"]
+        assert chat_1 == [
+            ("hi\none more thing\nand this", 3),
+            ("/help", 1),
+            ("after", 1),
+        ]
+        assert ("chat-2", "other chat", 1) in turns
+        stats = pipeline.get_stats()
+        assert stats["turns"] == 4 and stats["merged"] == 2
+        assert stats["duplicates"] == 1 and stats["queued"] == 0
+        await pipeline.close()
+        await inbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_streaming_reply_edits_and_continues_past_the_length_limit():
+    async def scenario():
+        messages = {}
+        calls = []
+
+        async def send(text):
+            handle = len(messages)
+            messages[handle] = text
+            calls.append("send")
+            return handle
+
+        async def edit(handle, text):
+            messages[handle] = text
+            calls.append("edit")
+
+        reply = StreamingReply(
+            send=send, edit=edit, max_length=50, edit_interval=0, first_chars=5
+        )
+        words = [f"word{i} " for i in range(20)]
+        for word in words:
+            await reply.push(word)
+        final = await reply.finish()
+
+        assert calls[0] == "send" and "edit" in calls
+        assert reply.time_to_first_reply is not None
+        assert all(len(text) <= 50 for text in messages.values())
+        assert final == list(messages.values()) and len(final) == 3
+        assert " ".join(final).split() == "".join(words).split()
+
+        # Without edits, text is only posted in full chunks and at the end
+        posted = []
+
+        async def post(text):
+            posted.append(text)
+
+        plain = StreamingReply(send=post, max_length=50)
+        for word in words:
+            await plain.push(word)
+        assert len(posted) == 2
+        await plain.finish()
+        assert " ".join(posted).split() == "".join(words).split()
+
+        empty = StreamingReply(send=post)
+        assert await empty.finish("nothing") == ["nothing"]
+
+    asyncio.run(scenario())
+
+
+def test_lookup_cache_keeps_misses_briefly_and_evicts_lru():
+    cache = LookupCache(ttl=60, miss_ttl=0, max_entries=2)
+    loads = []
+
+    def loader(value):
+        def load():
+            loads.append(value)
+            return value
+
+        return load
+
+    assert cache.get_or_load("a", loader("A")) == "A"
+    assert cache.get_or_load("a", loader("changed")) == "A"
+    # Misses expire at once here, so an unknown user is looked up again
+    assert cache.get_or_load("missing", loader(None)) is None
+    assert cache.get_or_load("missing", loader(None)) is None
+    cache.get_or_load("b", loader("B"))
+    cache.get_or_load("c", loader("C"))
+    assert cache.get_stats()["entries"] == 2
+    assert cache.get_or_load("a", loader("A2")) == "A2"
+    assert loads == ["A", None, None, "B", "C", "A2"]
+
+
+def test_stream_content_and_split_message():
+    async def chunks():
+        yield 'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n'
+        yield 'data: {"choices": [{"delta": {"content": "lo"}}]}\ndata: not json\n'
+        yield "data: [DONE]\n\n"
+        yield 'data: {"choices": [{"delta": {"content": "ignored"}}]}\n'
+
+    async def collect():
+        return [delta async for delta in iter_stream_content(chunks())]
+
+    assert asyncio.run(collect()) == ["Hel", "lo"]
+    text = "line one\n" + "x" * 30 + " tail"
+    assert split_message(text, 20) == ["line one", "x" * 20, "x" * 10 + " tail"]
+    assert split_message("short", 20) == ["short"]
@@ -0,0 +1,307 @@
+import asyncio
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.BotRuntime import (  # noqa: E402
+    BOT_CONFIG_CHANNEL,
+    BotRuntime,
+    CompanyInbox,
+    HashRing,
+    publish_bot_config_change,
+)
+from agixt.SharedCache import Subscription  # noqa: E402
+
+
+class LocalCache:
+    """Shared state of all workers, with a clock tests can move forward."""
+
+    def __init__(self):
+        self.values = {}
+        self.now = 0.0
+        self.subscriptions = []
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry and entry[1] and entry[1] <= self.now:
+            del self.values[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        entry = self._live(key)
+        return entry[0] if entry else default
+
+    def set(self, key, value, ttl=0):
+        self.values[key] = (value, self.now + ttl if ttl else None)
+        return True
+
+    def set_if_not_exists(self, key, value, ttl=0):
+        if self._live(key):
+            return False
+        return self.set(key, value, ttl)
+
+    def set_if_equals(self, key, expected, value, ttl=0):
+        if self.get(key) != expected:
+            return False
+        return self.set(key, value, ttl)
+
+    def delete_if_equals(self, key, expected):
+        if self.get(key) != expected:
+            return False
+        del self.values[key]
+        return True
+
+    def exists(self, key):
+        return self._live(key) is not None
+
+    def publish(self, channel, message):
+        for subscription in self.subscriptions:
+            subscription._deliver(message)
+        return len(self.subscriptions)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, on_close=self.subscriptions.remove)
+        self.subscriptions.append(subscription)
+        return subscription
+
+
+class FakeBot:
+    def __init__(self, company_id, config):
+        self.company_id = company_id
+        self.config = config
+        self.inbox = CompanyInbox(company_id, maxsize=4, concurrency=2)
+
+
+class FakeManager:
+    """The bot manager contract, with configs in a dict instead of the DB."""
+
+    SERVER_BOT_ID = "server"
+
+    def __init__(self, configs, server=None):
+        self.configs = configs
+        self.server = server
+        self.bots = {}
+        self.full_reads = 0
+        self.company_reads = 0
+        self.starts = []
+        self._running = False
+
+    def get_company_bot_config(self, company_id=None):
+        if company_id:
+            self.company_reads += 1
+            config = self.configs.get(company_id)
+            return {company_id: dict(config)} if config else {}
+        self.full_reads += 1
+        return {key: dict(config) for key, config in self.configs.items()}
+
+    def is_bot_runnable(self, config):
+        return config.get("enabled") == "true" and bool(config.get("token"))
+
+    def get_server_bot_config(self):
+        return self.server
+
+    async def start_bot_from_config(self, bot_id, config):
+        self.bots[bot_id] = FakeBot(bot_id, config)
+        self.starts.append(bot_id)
+        return True
+
+    async def stop_bot_for_company(self, bot_id):
+        bot = self.bots.pop(bot_id, None)
+        if bot:
+            await bot.inbox.close()
+        return bot is not None
+
+
+def company_configs(count):
+    return {
+        f"company-{i}": {"name": f"Company {i}", "token": f"t{i}", "enabled": "true"}
+        for i in range(count)
+    }
+
+
+def make_workers(cache, configs, count=3, **kwargs):
+    workers = []
+    for index in range(count):
+        runtime = BotRuntime(
+            "discord",
+            FakeManager(configs, **kwargs),
+            worker_index=index,
+            worker_count=count,
+            cache=cache,
+            lease_ttl=30,
+            resync_interval=0,
+            worker_id=f"worker-{index}",
+        )
+        runtime.heartbeat()
+        workers.append(runtime)
+    return workers
+
+
+def running(workers):
+    owners = {}
+    for runtime in workers:
+        for bot_id in runtime.manager.bots:
+            owners.setdefault(bot_id, []).append(runtime.worker_index)
+    return owners
+
+
+def test_hash_ring_only_moves_the_departed_workers_companies():
+    keys = [f"discord:company-{i}" for i in range(3000)]
+    ring = HashRing([0, 1, 2, 3])
+    before = {key: ring.node_for(key) for key in keys}
+    shares = [list(before.values()).count(node) for node in range(4)]
+    assert min(shares) > 3000 / 4 * 0.7
+
+    after = HashRing([0, 1, 3])
+    moved = [key for key in keys if after.node_for(key) != before[key]]
+    assert moved and all(before[key] == 2 for key in moved)
+
+
+def test_each_company_runs_once_and_moves_when_a_worker_dies():
+    async def scenario():
+        cache = LocalCache()
+        workers = make_workers(cache, company_configs(30))
+        for runtime in workers:
+            await runtime.rebalance()
+        owners = running(workers)
+        assert sorted(owners) == sorted(company_configs(30))
+        assert all(len(indexes) == 1 for indexes in owners.values())
+        assert all(len(runtime.manager.bots) > 0 for runtime in workers)
+
+        # Worker 1 stops heartbeating; its leases and heartbeat expire
+        dead = workers[1]
+        orphaned = set(dead.manager.bots)
+        survivors = [workers[0], workers[2]]
+        cache.now += 20
+        for runtime in survivors:
+            await runtime.tick()
+        # Alive until its heartbeat expires, so nothing moved yet
+        assert all(set(r.manager.bots).isdisjoint(orphaned) for r in survivors)
+        cache.now += 15
+        for runtime in survivors:
+            await runtime.tick()
+        owners = running(survivors)
+        assert sorted(owners) == sorted(company_configs(30))
+        assert all(len(indexes) == 1 for indexes in owners.values())
+        # Only the dead worker's companies were started again
+        restarted = set(workers[0].manager.starts[-len(orphaned) :]) | set(
+            workers[2].manager.starts
+        )
+        assert orphaned <= restarted
+
+        # It comes back: its companies wait until the survivors hand them off
+        dead.worker_id = "worker-1-restarted"
+        dead.manager.bots.clear()
+        dead.heartbeat()
+        await dead.rebalance()
+        assert not dead.manager.bots and dead._pending
+        for runtime in survivors:
+            await runtime.tick()
+        await dead.tick()
+        assert set(dead.manager.bots) == orphaned
+        assert all(len(indexes) == 1 for indexes in running(workers).values())
+
+    asyncio.run(scenario())
+
+
+def test_config_events_apply_to_one_company_without_a_full_resync():
+    async def scenario():
+        cache = LocalCache()
+        configs = company_configs(6)
+        configs["company-5"]["enabled"] = "false"
+        workers = make_workers(
+            cache, configs, server={"name": "Server bot", "token": "s"}
+        )
+        for runtime in workers:
+            runtime._subscription = cache.subscribe(BOT_CONFIG_CHANNEL)
+            await runtime.rebalance()
+        full_reads = sum(r.manager.full_reads for r in workers)
+        assert "server" not in running(workers)
+
+        async def deliver():
+            for runtime in workers:
+                event = runtime._subscription.get_message(timeout=0)
+                await runtime.handle_event(event)
+
+        configs["company-5"]["enabled"] = "true"
+        assert publish_bot_config_change("discord", "company-5", cache=cache) == 3
+        await deliver()
+        assert running(workers)["company-5"] == [
+            r.worker_index for r in workers if r.assigned("company-5")
+        ]
+        assert sum(r.manager.full_reads for r in workers) == full_reads
+
+        # A changed setting restarts the running bot with the new config
+        configs["company-5"]["token"] = "rotated"
+        publish_bot_config_change("discord", "company-5", cache=cache)
+        await deliver()
+        owner = next(r for r in workers if "company-5" in r.manager.bots)
+        assert owner.manager.bots["company-5"].config["token"] == "rotated"
+
+        # Events for other platforms are ignored
+        publish_bot_config_change("slack", "company-0", cache=cache)
+        await deliver()
+        assert sum(r.stats["events"] for r in workers) == 6
+
+        # Disabling the last company bot brings the shared server bot back
+        for company_id in configs:
+            configs[company_id]["enabled"] = "false"
+            publish_bot_config_change("discord", company_id, cache=cache)
+            await deliver()
+        assert list(running(workers)) == ["server"]
+
+    asyncio.run(scenario())
+
+
+def test_inbox_limits_concurrency_and_applies_backpressure():
+    async def scenario():
+        inbox = CompanyInbox("busy", maxsize=3, concurrency=2)
+        other = CompanyInbox("quiet", maxsize=3, concurrency=2)
+        release = asyncio.Event()
+        active, peak = [0], [0]
+
+        async def slow():
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await release.wait()
+            active[0] -= 1
+
+        accepted = [inbox.submit(slow) for _ in range(8)]
+        await asyncio.sleep(0.01)
+        # Two are handled, three wait; the rest are refused, not queued
+        assert accepted.count(True) < 8 and peak[0] == 2
+        assert inbox.get_stats()["rejected"] == 8 - accepted.count(True)
+        assert inbox.get_stats()["queued"] <= 3
+
+        # A flooded tenant does not hold up another one
+        done = []
+
+        async def quick():
+            done.append(time.perf_counter())
+
+        assert other.submit(quick)
+        await asyncio.wait_for(other.join(), timeout=1)
+        assert done
+
+        async def failing():
+            raise RuntimeError("handler bug")
+
+        release.set()
+        await asyncio.wait_for(inbox.join(), timeout=1)
+        assert inbox.submit(failing)
+        await inbox.join()
+        stats = inbox.get_stats()
+        assert stats["processed"] == accepted.count(True)
+        assert stats["failed"] == 1 and peak[0] == 2
+        await inbox.close()
+        await other.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,210 @@
+import fnmatch
+import os
+import re
+import sys
+import time
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.CodeIndex import (  # noqa: E402
+    BINARY_EXTENSIONS,
+    CodeIndex,
+    extract_symbols,
+    required_literals,
+)
+
+
+def walk_search(root, query, pattern="**/*", is_regex=False):
+    """The walk-and-read implementation the index replaces, used as the oracle."""
+    regex = re.compile(query, re.IGNORECASE) if is_regex else None
+    results = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        rel_root = os.path.relpath(dirpath, root)
+        for filename in filenames:
+            rel_path = filename if rel_root == "." else f"{rel_root}/{filename}"
+            if not fnmatch.fnmatch(rel_path, pattern) and not fnmatch.fnmatch(
+                filename, pattern.split("/")[-1] if "/" in pattern else pattern
+            ):
+                continue
+            if os.path.splitext(filename)[1].lower() in BINARY_EXTENSIONS:
+                continue
+            with open(
+                os.path.join(dirpath, filename), "r", encoding="utf-8", errors="ignore"
+            ) as f:
+                for line_num, line in enumerate(f.readlines(), 1):
+                    found = (
+                        regex.search(line)
+                        if is_regex
+                        else query.lower() in line.lower()
+                    )
+                    if found:
+                        results.append((rel_path, line_num, line))
+    return results
+
+
+def write(root, rel_path, content):
+    full_path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return full_path
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    root = str(tmp_path)
+    write(
+        root,
+        "app/auth.py",
+        "import jwt\n\n\nclass TokenManager:\n    def verify_token(self, token):\n"
+        "        return jwt.decode(token)\n\n\nMAX_RETRIES = 3\n",
+    )
+    write(
+        root,
+        "app/views.py",
+        "from app.auth import TokenManager\n\n\nasync def login(request):\n"
+        "    manager = TokenManager()\n    return manager.verify_token(request.token)\n",
+    )
+    write(
+        root,
+        "web/client.js",
+        "export function fetchToken(url) {\n  return fetch(url);\n}\n"
+        "const ERROR_E1042 = 'E1042';\n",
+    )
+    write(root, "docs/notes.md", "Token rotation\r\nhappens daily\fweekly\n")
+    write(root, "server/main.go", "package main\n\nfunc HandleToken(w, r) {\n}\n")
+    write(root, "assets/logo.png", "token")
+    return root
+
+
+@pytest.mark.parametrize(
+    "query,pattern,is_regex",
+    [
+        ("token", "**/*", False),
+        ("TokenManager", "**/*.py", False),
+        ("E1042", "**/*", False),
+        ("to", "**/*", False),
+        (r"def \w+_token", "**/*", True),
+        (r"verify|fetch", "**/*", True),
+        (r"^func\s+Handle", "**/*.go", True),
+        (r"jwt\.(decode|encode)", "**/*", True),
+        ("no-such-text", "**/*", False),
+    ],
+)
+def test_search_matches_walk_results(workspace, query, pattern, is_regex):
+    index = CodeIndex(workspace)
+    indexed = list(index.search(query, pattern=pattern, is_regex=is_regex))
+    assert indexed == walk_search(workspace, query, pattern, is_regex)
+
+
+def test_incremental_refresh_only_reads_changed_files(workspace):
+    index = CodeIndex(workspace)
+    index.refresh()
+    files_read = index.stats["files_read"]
+
+    index.refresh()
+    assert index.stats["files_read"] == files_read
+
+    path = write(workspace, "app/views.py", "def logout():\n    pass\n")
+    # Make sure the mtime moves even on coarse filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert list(index.search("logout")) == [("app/views.py", 1, "def logout():\n")]
+    assert index.stats["files_read"] == files_read + 1
+
+    os.remove(path)
+    assert list(index.search("logout")) == []
+    assert index.find_definitions("login") == []
+
+
+def test_notifications_update_index_without_refresh(workspace):
+    index = CodeIndex(workspace)
+    index.refresh()
+    path = write(workspace, "app/new_module.py", "def brand_new():\n    pass\n")
+    index.notify_changed(path)
+    assert index.find_definitions("brand_new", refresh=False) == [
+        ("app/new_module.py", 1, "function")
+    ]
+    assert [r[0] for r in index.search("brand_new", refresh=False)] == [
+        "app/new_module.py"
+    ]
+
+    index.notify_deleted("app/new_module.py")
+    assert list(index.search("brand_new", refresh=False)) == []
+
+
+def test_symbol_table_covers_python_and_heuristic_languages(workspace):
+    index = CodeIndex(workspace)
+    assert index.find_definitions("TokenManager") == [("app/auth.py", 4, "class")]
+    assert index.find_definitions("verify_token") == [("app/auth.py", 5, "function")]
+    assert index.find_definitions("MAX_RETRIES") == [("app/auth.py", 9, "variable")]
+    assert index.find_definitions("login") == [("app/views.py", 4, "function")]
+    assert index.find_definitions("fetchToken") == [("web/client.js", 1, "function")]
+    assert index.find_definitions("HandleToken") == [("server/main.go", 3, "function")]
+
+
+def test_extract_symbols_falls_back_for_invalid_python():
+    symbols = extract_symbols("broken.py", "def ok():\n    pass\n\ndef broken(:\n")
+    assert ("ok", 1, "function") in symbols
+    assert ("broken", 4, "function") in symbols
+
+
+def test_required_literals_never_over_constrain():
+    assert required_literals("verify_token") == ["verify_token"]
+    assert required_literals(r"jwt\.(decode|encode)") == ["jwt."]
+    assert required_literals("foo|bar") == []
+    assert required_literals(r"abc\d+xyz") == ["abc", "xyz"]
+    assert required_literals("a(bc)?d") == []
+
+
+def test_large_files_are_searched_from_disk(workspace, monkeypatch):
+    import agixt.CodeIndex as code_index_module
+
+    monkeypatch.setattr(code_index_module, "MAX_INDEXED_FILE_BYTES", 16)
+    write(workspace, "big.txt", "x" * 64 + "\nneedle here\n")
+    index = CodeIndex(workspace)
+    assert ("big.txt", 2, "needle here\n") in list(index.search("needle"))
+    assert index.get_stats()["unindexed_files"] >= 1
+
+
+def test_dependency_and_build_directories_are_not_indexed(workspace):
+    for directory in ("node_modules/jwt", ".venv/lib", "__pycache__", "dist", "build"):
+        write(workspace, f"{directory}/vendored.py", "def verify_token():\n    pass\n")
+    index = CodeIndex(workspace)
+    assert {path for path, _, _ in index.search("verify_token")} == {
+        "app/auth.py",
+        "app/views.py",
+    }
+    assert index.get_stats()["files"] == 5
+
+
+def test_repeated_queries_are_faster_than_walking(workspace):
+    for i in range(200):
+        write(
+            workspace,
+            f"pkg{i % 10}/module_{i}.py",
+            "".join(f"def function_{i}_{j}():\n    return {j}\n" for j in range(50)),
+        )
+    index = CodeIndex(workspace)
+    index.refresh()
+
+    start = time.perf_counter()
+    for _ in range(5):
+        walk_results = walk_search(workspace, "function_42_7")
+    walk_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(5):
+        indexed_results = list(index.search("function_42_7"))
+    index_time = time.perf_counter() - start
+
+    assert indexed_results == walk_results
+    assert index_time < walk_time
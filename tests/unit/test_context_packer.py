@@ -0,0 +1,122 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.ContextPacker import (  # noqa: E402
+    TRIM_OLDEST,
+    ContextItem,
+    ContextPacker,
+    ContextSection,
+)
+
+
+class WordCounter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return len(text.split())
+
+
+def words(count, word="w"):
+    return " ".join([word] * count)
+
+
+def memories(*sizes):
+    return ContextSection(
+        name="memories",
+        items=[
+            ContextItem(words(size, f"m{rank}"), score=1 / (1 + rank))
+            for rank, size in enumerate(sizes)
+        ],
+        priority=2,
+        share=0.2,
+    )
+
+
+def history(*sizes):
+    return ContextSection(
+        name="conversation_history",
+        items=[
+            ContextItem(words(size, f"h{index}")) for index, size in enumerate(sizes)
+        ],
+        priority=1,
+        share=0.3,
+        trim=TRIM_OLDEST,
+    )
+
+
+def test_context_that_fits_is_untouched():
+    packer = ContextPacker(count_tokens=WordCounter())
+    sections = [
+        memories(10, 10),
+        history(5, 5),
+        ContextSection.text("persona", words(20)),
+    ]
+    texts, report = packer.pack(sections, budget=100, fixed_tokens=40)
+    assert report.fits and not report.needs_reduction
+    assert texts == {section.name: section.render() for section in sections}
+    assert report.tokens == 90
+    assert packer.get_stats()["trimmed_turns"] == 0
+
+
+def test_trims_by_relevance_and_recency_within_grants():
+    packer = ContextPacker(count_tokens=WordCounter())
+    sections = [
+        # Reserved 20 and 30 of the 100 available; the rest goes to history first
+        memories(30, 15, 10, 40),
+        history(30, 20, 20, 20, 10),
+        ContextSection.text("persona", words(20)),
+    ]
+    texts, report = packer.pack(sections, budget=120, fixed_tokens=20)
+    assert not report.fits and not report.needs_reduction
+    by_name = {section.name: section for section in report.sections}
+    # History: 30 reserved plus the 30 left over keeps its newest 50 tokens
+    assert texts["conversation_history"].split()[0] == "h2"
+    assert by_name["conversation_history"].kept_items == 3
+    # Memories: 20 reserved only fits the second best; offered the 15 history
+    # could not use, the best memory (30 tokens) fits instead
+    assert by_name["memories"].grant == 30
+    assert [line.split()[0] for line in texts["memories"].split("\n")] == ["m0"]
+    assert report.tokens == 120
+    assert "conversation_history p1 100->50 (3/5 kept" in report.summary()
+
+
+def test_untrimmable_overflow_requests_llm_reduction():
+    packer = ContextPacker(count_tokens=WordCounter())
+    sections = [
+        memories(30, 30, 30),
+        history(30, 30, 30),
+        ContextSection.text("file_contents", words(500)),
+    ]
+    texts, report = packer.pack(sections, budget=200, fixed_tokens=0)
+    assert report.needs_reduction
+    # Trimmable sections still shrink to their reserved shares
+    assert texts["memories"] == words(30, "m0")
+    assert report.sections[1].kept_tokens == 60
+    packer.record_llm_reduction(report)
+    assert report.summary().startswith("[context_packer] llm reduction")
+    stats = packer.get_stats()
+    assert stats["llm_reductions"] == 1 and stats["llm_reduction_rate"] == 1.0
+
+
+def test_token_counts_are_cached_across_turns():
+    counter = WordCounter()
+    packer = ContextPacker(count_tokens=counter, cache_size=4)
+    turn = [history(5, 5, 5)]
+    packer.pack(turn, budget=100)
+    assert counter.calls == 3
+    # The next turn rebuilds the sections from the same texts plus one new one
+    _, report = packer.pack([history(5, 5, 5, 7)], budget=100)
+    assert counter.calls == 4
+    assert (report.cache_hits, report.counted) == (3, 4)
+    # The least recently used count is evicted past cache_size
+    packer.count("something new entirely")
+    assert packer.get_stats()["cached_token_counts"] == 4
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi import HTTPException
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.CredentialService import (  # noqa: E402
+    CredentialService,
+    HashParameters,
+    TokenBucket,
+    size_workers,
+)
+
+# Cheap parameters so the tests stay fast
+FAST = HashParameters(time_cost=1, memory_cost=1024)
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_service(clock=None, **kwargs):
+    cache = LocalCache()
+    clock = clock or Clock()
+    kwargs.setdefault("params", FAST)
+    kwargs.setdefault("workers", 1)
+    return CredentialService(
+        ip_bucket=TokenBucket("ip", 3, 6, cache=cache, clock=clock),
+        account_bucket=TokenBucket("account", 2, 1, cache=cache, clock=clock),
+        **kwargs,
+    )
+
+
+def test_hashes_verify_in_the_pool_and_old_parameters_need_rehash():
+    service = make_service()
+    try:
+        password_hash = service.hash_sync("correct horse")
+        assert password_hash.startswith("$argon2id$")
+        assert service.verify_sync("correct horse", password_hash) == (True, False)
+        assert service.verify_sync("wrong", password_hash) == (False, False)
+        assert service.verify_sync("x", "not-a-hash") == (False, False)
+        assert service.verify_sync("x", None) == (False, False)
+        assert asyncio.run(service.verify("correct horse", password_hash)) == (
+            True,
+            False,
+        )
+        stronger = make_service(params=HashParameters(time_cost=2, memory_cost=1024))
+        assert stronger.needs_rehash(password_hash)
+        assert stronger.verify_sync("correct horse", password_hash) == (True, True)
+        assert stronger.stats["rehashes_needed"] == 1
+        stronger.shutdown()
+        assert service.get_stats()["pending"] == 0
+    finally:
+        service.shutdown()
+
+
+def test_saturated_pool_refuses_with_429_before_hashing():
+    service = make_service(queue_per_worker=0)
+    try:
+        # The first task waits for a freshly spawned worker
+        first = service._submit("hashes", pow, 2, 10)
+        assert service.saturated
+        with pytest.raises(HTTPException) as error:
+            service.hash_sync("another")
+        assert error.value.status_code == 429
+        assert int(error.value.headers["Retry-After"]) >= 1
+        with pytest.raises(HTTPException):
+            service.check_login("10.0.0.1", "someone")
+        assert first.result(timeout=60) == 1024
+        assert service.stats["busy_rejections"] == 2
+    finally:
+        service.shutdown()
+
+
+class BrokenPool:
+    def submit(self, fn, *args):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_failed_pool_restart_releases_the_pending_slot():
+    service = make_service(queue_per_worker=1)
+    service._get_pool = lambda: BrokenPool()
+    for _ in range(3):
+        with pytest.raises(BrokenProcessPool):
+            service._submit("hashes", pow, 2, 10)
+    assert service.pending == 0
+
+
+def test_ip_and_account_buckets_throttle_and_refill():
+    clock = Clock()
+    service = make_service(clock=clock)
+    # Account burst is 2: the third guess at one account waits a minute
+    service.check_login("10.0.0.1", "Alice")
+    service.check_login("10.0.0.2", "alice ")
+    with pytest.raises(HTTPException) as error:
+        service.check_login("10.0.0.3", "ALICE")
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == "60"
+    # A successful login gives the account its burst back
+    service.record_login_success("alice")
+    service.check_login("10.0.0.4", "alice")
+
+    # IP burst is 3 at 6 per minute, across accounts
+    for account in ("bob", "carol", "erin"):
+        service.check_login("10.0.0.9", account)
+    with pytest.raises(HTTPException) as error:
+        service.check_login("10.0.0.9", "dave")
+    assert "Too many login attempts" in error.value.detail
+    assert service.stats["throttled_ip"] == 1
+    clock.now += 10
+    service.check_login("10.0.0.9", "dave")
+
+
+def test_pool_is_sized_to_memory_and_cpus():
+    gib = 1024**3
+    assert size_workers(65536, 0.25, available_bytes=2 * gib, cpus=16) == 4
+    assert size_workers(65536, 0.25, available_bytes=64 * gib, cpus=8) == 8
+    assert size_workers(65536, 0.25, available_bytes=gib // 4, cpus=8) == 1
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import stat
+import sys
+import zipfile
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+BENCHMARKS = os.path.join(PROJECT_ROOT, "tests", "benchmarks")
+if BENCHMARKS not in sys.path:
+    sys.path.insert(0, BENCHMARKS)
+
+from agixt import DocumentIngestion  # noqa: E402
+from agixt.DocumentIngestion import (  # noqa: E402
+    IngestionJobManager,
+    ZipLimits,
+    extract_document,
+    extract_zip,
+    get_extractor,
+    throttle_progress,
+)
+from document_ingestion_benchmark import make_pdf  # noqa: E402
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = dict(value)
+
+
+def page_numbers(text):
+    return [
+        int(line.split()[1])
+        for line in text.splitlines()
+        if line.startswith("Page ") and " line 1 " in line
+    ]
+
+
+def test_extractor_registry():
+    assert get_extractor("report.PDF") is DocumentIngestion.extract_pdf
+    assert get_extractor("notes.docx") is DocumentIngestion.extract_docx
+    assert get_extractor("deck.pptx") is DocumentIngestion.extract_pptx
+    assert get_extractor("archive.zip") is None
+    with pytest.raises(ValueError):
+        asyncio.run(extract_document("image.png"))
+
+
+def test_throttle_progress():
+    calls = []
+    report = throttle_progress(lambda done, total: calls.append(done), steps=4)
+    for done in range(1, 101):
+        report(done, 100)
+    assert calls == [1, 25, 50, 75, 100]
+
+
+def test_pdf_extraction_in_process(tmp_path):
+    path = str(tmp_path / "doc.pdf")
+    make_pdf(path, pages=3, lines_per_page=5)
+    progress = []
+    document = asyncio.run(
+        extract_document(path, progress=lambda done, total: progress.append(done))
+    )
+    assert document.label == "PDF" and document.units == 3
+    assert page_numbers(document.text) == [1, 2, 3]
+    assert progress[-1] == 3
+
+
+def test_pdf_pages_extracted_in_parallel_keep_order(tmp_path, monkeypatch):
+    path = str(tmp_path / "doc.pdf")
+    make_pdf(path, pages=9, lines_per_page=3)
+    monkeypatch.setattr(DocumentIngestion, "PDF_WORKERS", 2)
+    monkeypatch.setattr(DocumentIngestion, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(DocumentIngestion, "PDF_PAGES_PER_TASK", 2)
+    progress = []
+    try:
+        document = DocumentIngestion.extract_pdf(
+            path, progress=lambda done, total: progress.append((done, total))
+        )
+    finally:
+        DocumentIngestion.shutdown_process_pool()
+    assert page_numbers(document.text) == list(range(1, 10))
+    assert len(progress) == 5 and progress[-1] == (9, 9)
+
+
+def test_pptx_extraction(tmp_path):
+    from pptx import Presentation
+
+    presentation = Presentation()
+    for title in ("Quarterly results", "Next steps"):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[0])
+        slide.shapes.title.text = title
+    path = str(tmp_path / "deck.pptx")
+    presentation.save(path)
+    document = asyncio.run(extract_document(path))
+    assert document.units == 2 and document.unit_name == "slide"
+    assert document.text == "Slide 1:\nQuarterly results\n\nSlide 2:\nNext steps"
+
+
+def test_zip_extraction_skips_unsafe_members(tmp_path):
+    path = tmp_path / "upload.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("docs/", "")
+        archive.writestr("docs/readme.md", "hello")
+        archive.writestr("src/main.py", "print('hi')")
+        archive.writestr("../escape.txt", "nope")
+        archive.writestr("/etc/absolute.txt", "nope")
+        link = zipfile.ZipInfo("docs/link")
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        archive.writestr(link, "/etc/passwd")
+    destination = tmp_path / "out"
+    progress = []
+    result = extract_zip(
+        str(path), str(destination), progress=lambda d, t: progress.append(d)
+    )
+    assert (result.files, result.directories) == (2, 1)
+    assert sorted(result.skipped) == [
+        "../escape.txt",
+        "/etc/absolute.txt",
+        "docs/link",
+    ]
+    assert (destination / "docs" / "readme.md").read_text() == "hello"
+    assert not (tmp_path / "escape.txt").exists()
+    assert not (destination / "docs" / "link").exists()
+    assert progress[-1] == 6
+
+
+def test_zip_limits(tmp_path):
+    path = tmp_path / "many.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        for index in range(5):
+            archive.writestr(f"file{index}.txt", "x" * 100)
+    with pytest.raises(ValueError, match="entries"):
+        extract_zip(str(path), str(tmp_path / "a"), ZipLimits(max_members=4))
+    with pytest.raises(ValueError, match="expands to"):
+        extract_zip(str(path), str(tmp_path / "b"), ZipLimits(max_total_bytes=400))
+    assert not (tmp_path / "a").exists() and not (tmp_path / "b").exists()
+
+    bomb = tmp_path / "bomb.zip"
+    with zipfile.ZipFile(bomb, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("zeros.bin", b"\0" * (8 * 1024 * 1024))
+    with pytest.raises(ValueError, match="compression ratio"):
+        extract_zip(str(bomb), str(tmp_path / "c"))
+    assert not (tmp_path / "c").exists()
+
+
+def test_ingestion_job_records_progress_and_result():
+    manager = IngestionJobManager(cache=LocalCache())
+
+    async def scenario():
+        async def learn(on_progress):
+            for done in range(1, 4):
+                on_progress("extracting", done, 3)
+            on_progress("memorizing", 0, 1)
+            return "Learned [report.pdf]"
+
+        async def fail(on_progress):
+            raise RuntimeError("unreadable")
+
+        job = manager.submit(user_id="u1", file_name="report.pdf", run=learn)
+        assert job["status"] == "queued"
+        failed = manager.submit(user_id="u1", file_name="bad.pdf", run=fail)
+        await manager.wait(job["id"])
+        await manager.wait(failed["id"])
+        return job["id"], failed["id"]
+
+    job_id, failed_id = asyncio.run(scenario())
+    record = manager.get(job_id, user_id="u1")
+    assert record["status"] == "completed"
+    assert record["message"] == "Learned [report.pdf]"
+    assert (record["done"], record["total"]) == (0, 1)
+    assert manager.get(job_id, user_id="someone-else") is None
+    failed = manager.get(failed_id, user_id="u1")
+    assert failed["status"] == "failed" and failed["error"] == "unreadable"
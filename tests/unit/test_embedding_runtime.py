@@ -0,0 +1,121 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+BENCHMARKS = os.path.join(PROJECT_ROOT, "tests", "benchmarks")
+if BENCHMARKS not in sys.path:
+    sys.path.insert(0, BENCHMARKS)
+
+from agixt import EmbeddingService  # noqa: E402
+from agixt.EmbeddingService import (  # noqa: E402
+    OnnxEmbedder,
+    default_intra_op_threads,
+    quantize_model,
+)
+from embedding_benchmark import make_tiny_model  # noqa: E402
+
+TEXTS = [
+    "Short one.",
+    "",
+    "A much longer sentence about deployment pipelines, database migrations "
+    "and the certificates that expire at the worst possible moment. " * 3,
+    "Error 0x80070005",
+    "word " * 400,
+    "Medium length text that mentions a few different things.",
+    "ok",
+]
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("onnx")
+    make_tiny_model(str(directory), hidden_size=32, layers=2)
+    return str(directory)
+
+
+def padded_reference(model_dir, texts):
+    """Memories.embed as it was: every input padded to 256, batches of 32"""
+    from onnxruntime import InferenceSession
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+    tokenizer.enable_truncation(max_length=256)
+    tokenizer.enable_padding(pad_id=0, pad_token="[PAD]", length=256)
+    model = InferenceSession(os.path.join(model_dir, "model.onnx"))
+    all_embeddings = []
+    for i in range(0, len(texts), 32):
+        encoded = [tokenizer.encode(d) for d in texts[i : i + 32]]
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        last_hidden_state = model.run(
+            None,
+            {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids),
+            },
+        )[0]
+        mask = np.broadcast_to(
+            np.expand_dims(attention_mask, -1), last_hidden_state.shape
+        )
+        embeddings = np.sum(last_hidden_state * mask, 1) / np.clip(
+            mask.sum(1), a_min=1e-9, a_max=None
+        )
+        embeddings /= np.linalg.norm(embeddings, axis=1)[:, np.newaxis]
+        all_embeddings.append(embeddings)
+    return np.concatenate(all_embeddings)
+
+
+def test_length_buckets_match_fixed_padding(model_dir):
+    reference = padded_reference(model_dir, TEXTS)
+    for batch_size in (32, 3):
+        embedder = OnnxEmbedder(model_dir=model_dir, batch_size=batch_size)
+        vectors = np.array(embedder(TEXTS))
+        assert vectors.shape == reference.shape
+        np.testing.assert_allclose(vectors, reference, atol=1e-5)
+    padded = OnnxEmbedder(model_dir=model_dir, bucket_by_length=False)
+    np.testing.assert_allclose(np.array(padded(TEXTS)), reference, atol=1e-5)
+
+
+def test_quantized_model_stays_close(model_dir, monkeypatch):
+    quantize_model(model_dir)
+    monkeypatch.setattr(EmbeddingService, "EMBEDDING_QUANTIZED", True)
+    quantized = OnnxEmbedder(model_dir=model_dir)
+    vectors = np.array(quantized(TEXTS))
+    assert quantized.model_file == "model_quantized.onnx"
+    # Both are unit vectors, so the row-wise dot product is cosine similarity
+    similarity = np.sum(vectors * padded_reference(model_dir, TEXTS), axis=1)
+    assert similarity.min() > 0.98
+
+
+def test_intra_op_threads_follow_worker_count(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 16)
+    monkeypatch.delenv("EMBEDDING_INTRA_OP_THREADS", raising=False)
+    monkeypatch.setenv("UVICORN_WORKERS", "4")
+    assert default_intra_op_threads() == 4
+    monkeypatch.setenv("UVICORN_WORKERS", "40")
+    assert default_intra_op_threads() == 1
+    monkeypatch.setenv("EMBEDDING_INTRA_OP_THREADS", "6")
+    assert default_intra_op_threads() == 6
+
+
+def test_warmup_and_self_benchmark(model_dir):
+    embedder = OnnxEmbedder(model_dir=model_dir, intra_op_threads=1)
+    assert embedder.warmup() > 0
+    report = embedder.benchmark(texts=TEXTS, rounds=1)
+    assert report["texts"] == len(TEXTS)
+    assert report["model_file"] == "model.onnx"
+    assert report["intra_op_threads"] == 1
+    assert report["bucketed_texts_per_second"] > 0 and report["speedup"] > 0
@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.EmbeddingService import EmbeddingBatcher, format_embedding  # noqa: E402
+
+
+class FakeEmbedder:
+    """Embeds "text N" as [N, 1, 0, 0] and records every model call"""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+        self.threads = set()
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        self.threads.add(threading.current_thread().name)
+        # Blocks like a real forward pass would
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        return [[float(text.split()[-1]), 1.0, 0.0, 0.0] for text in texts]
+
+
+def test_concurrent_requests_share_one_model_call():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_batch_size=32, window_ms=20)
+
+    async def scenario():
+        return await asyncio.gather(
+            batcher.embed(["text 1"]),
+            batcher.embed(["text 2", "text 3"]),
+            batcher.embed(["text 3", "text 4"]),
+        )
+
+    results = asyncio.run(scenario())
+    batcher.shutdown()
+    assert [[vector[0] for vector in result] for result in results] == [
+        [1.0],
+        [2.0, 3.0],
+        [3.0, 4.0],
+    ]
+    # One call, with the repeated text embedded once, off the event loop
+    assert embedder.batches == [["text 1", "text 2", "text 3", "text 4"]]
+    assert all(name.startswith("embedding") for name in embedder.threads)
+    assert batcher.stats["requests"] == 3 and batcher.stats["batches"] == 1
+
+
+def test_full_batch_flushes_without_waiting_and_splits_model_calls():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_batch_size=4, window_ms=10_000)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            batcher.embed([f"text {i}" for i in range(10)]), timeout=5
+        )
+
+    vectors = asyncio.run(scenario())
+    batcher.shutdown()
+    assert [vector[0] for vector in vectors] == [float(i) for i in range(10)]
+    assert [len(batch) for batch in embedder.batches] == [4, 4, 2]
+
+
+def test_errors_reach_every_waiting_request():
+    batcher = EmbeddingBatcher(FakeEmbedder(fail=True), window_ms=5)
+
+    async def scenario():
+        return await asyncio.gather(
+            batcher.embed(["text 1"]),
+            batcher.embed(["text 2"]),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(scenario())
+    batcher.shutdown()
+    assert [str(result) for result in results] == ["model unavailable"] * 2
+
+
+def test_event_loop_stays_responsive_during_inference():
+    batcher = EmbeddingBatcher(FakeEmbedder(delay=0.3), window_ms=1)
+
+    async def scenario():
+        lags = []
+
+        async def ticker():
+            for _ in range(20):
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        await asyncio.gather(batcher.embed(["text 1"]), ticker())
+        return max(lags)
+
+    max_lag = asyncio.run(scenario())
+    batcher.shutdown()
+    assert max_lag < 0.1
+
+
+def test_format_embedding_dimensions_and_base64():
+    vector = [0.6, 0.0, 0.8, 0.0]
+    assert format_embedding(vector) == pytest.approx(vector)
+    shortened = format_embedding(vector, dimensions=2)
+    assert shortened == pytest.approx([1.0, 0.0])
+    encoded = format_embedding(vector, encoding_format="base64", dimensions=3)
+    decoded = np.frombuffer(base64.b64decode(encoded), dtype="<f4")
+    assert decoded.tolist() == pytest.approx([0.6, 0.0, 0.8])
@@ -0,0 +1,330 @@
+import os
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    String,
+    create_engine,
+    update,
+)
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.Entitlements import (  # noqa: E402
+    Entitlement,
+    EntitlementEngine,
+    EntitlementModels,
+    utcnow,
+)
+
+Base = declarative_base()
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+class Company(Base):
+    __tablename__ = "Company"
+    id = Column(String, primary_key=True, default=new_id)
+    company_id = Column(String, nullable=True)
+    name = Column(String)
+    user_limit = Column(Integer, nullable=True, default=1)
+    token_balance = Column(Integer, nullable=False, default=0)
+    token_balance_usd = Column(Float, nullable=False, default=0.0)
+    tokens_used_total = Column(Integer, nullable=False, default=0)
+    auto_topup_enabled = Column(Boolean, nullable=False, default=False)
+    stripe_subscription_id = Column(String, nullable=True)
+    plan_id = Column(String, nullable=True)
+    device_count = Column(Integer, nullable=False, default=0)
+    storage_used_bytes = Column(Integer, nullable=False, default=0)
+    tokens_used_this_period = Column(Integer, nullable=False, default=0)
+    current_period_start = Column(DateTime, nullable=True)
+    addon_users = Column(Integer, nullable=False, default=0)
+    addon_devices = Column(Integer, nullable=False, default=0)
+    addon_tokens = Column(Integer, nullable=False, default=0)
+    addon_storage_bytes = Column(Integer, nullable=False, default=0)
+    billing_version = Column(Integer, nullable=True, default=0)
+
+
+class UserCompany(Base):
+    __tablename__ = "UserCompany"
+    id = Column(String, primary_key=True, default=new_id)
+    user_id = Column(String, nullable=False)
+    company_id = Column(String, nullable=False)
+    role_id = Column(Integer, nullable=False, default=3)
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def delete_pattern(self, pattern):
+        prefix = pattern.split("*")[0]
+        for key in [k for k in self.values if k.startswith(prefix)]:
+            del self.values[key]
+
+
+PRICING = {
+    "pricing_model": "tiered_plan",
+    "tiers": [
+        {
+            "id": "team",
+            "limits": {"tokens": 1000, "users": 3, "devices": 2, "storage_gb": 1},
+        }
+    ],
+}
+
+
+class Counter:
+    def __init__(self, value):
+        self.calls = 0
+        self.value = value
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def make_engine(pricing=PRICING, url="sqlite://", **kwargs):
+    if url == "sqlite://":
+        db = create_engine(
+            url, connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+    else:
+        db = create_engine(url, connect_args={"timeout": 30})
+    Base.metadata.create_all(db)
+
+    # Listeners are installed per session class, once, as MagicalAuth does
+    class WatchedSession(Session):
+        pass
+
+    factory = sessionmaker(bind=db, class_=WatchedSession)
+    engine = EntitlementEngine(
+        cache=LocalCache(),
+        session_factory=factory,
+        models=EntitlementModels(company=Company, user_company=UserCompany),
+        token_price=Counter(5.0),
+        pricing_config=lambda: pricing,
+        **kwargs,
+    )
+    engine.watch(Company, UserCompany, session_class=WatchedSession)
+    return engine, factory
+
+
+def test_period_rollover_and_overage_charges():
+    engine, factory = make_engine()
+    session = factory()
+    started = utcnow() - timedelta(days=40)
+    root = Company(
+        name="root",
+        plan_id="team",
+        token_balance=500,
+        tokens_used_this_period=900,
+        current_period_start=started,
+    )
+    session.add(root)
+    session.commit()
+
+    entitlement = engine.get(root.id)
+    assert entitlement.token_limit == 1000
+    assert entitlement.period_elapsed() and entitlement.tokens_used() == 0
+    assert entitlement.has_credit("tiered_plan")
+
+    # The ended period is reset before charging; within the allowance
+    charged = engine.charge(session, root.id, 300)
+    session.commit()
+    session.refresh(root)
+    assert root.tokens_used_this_period == 300 and root.token_balance == 500
+    assert root.current_period_start > started + timedelta(days=39)
+    assert charged.version == root.billing_version
+    assert engine.get(root.id).tokens_used_this_period == 300
+
+    # Only the part over the allowance comes out of the balance
+    engine.charge(session, root.id, 800)
+    session.commit()
+    session.refresh(root)
+    assert root.tokens_used_this_period == 1100 and root.token_balance == 400
+    assert root.tokens_used_total == 1100
+    # Served from the entry the charge cached, not reloaded
+    loads = engine.stats["loads"]
+    assert engine.get(root.id).token_balance == 400
+    assert engine.stats["loads"] == loads
+
+    session.execute(update(Company).values(token_balance=0))
+    session.commit()
+    engine.invalidate(root.id)
+    with pytest.raises(HTTPException) as raised:
+        engine.charge(session, root.id, 10)
+    assert raised.value.status_code == 402
+    session.rollback()
+    session.refresh(root)
+    assert root.tokens_used_this_period == 1100
+    session.close()
+
+
+def test_parent_and_child_companies_share_the_root_entitlement():
+    engine, factory = make_engine()
+    session = factory()
+    root = Company(name="root", plan_id="team", token_balance=0)
+    session.add(root)
+    session.flush()
+    child = Company(name="child", company_id=root.id)
+    session.add(child)
+    session.flush()
+    session.add_all(
+        [
+            UserCompany(user_id="owner", company_id=root.id, role_id=1),
+            UserCompany(user_id="member", company_id=child.id),
+        ]
+    )
+    session.commit()
+
+    assert engine.root_of(child.id) == root.id
+    assert engine.billing_entitlement(child.id).company_id == root.id
+    assert engine.get(root.id).user_count == 2
+    assert sorted(engine.get(root.id).org_company_ids) == sorted([root.id, child.id])
+    # No credit anywhere in the org yet
+    assert not engine.has_billing_access("member")
+
+    # ORM writes bump the version and drop the cached entry on commit
+    version = engine.get(root.id).version
+    root.token_balance_usd = 5.0
+    session.commit()
+    assert root.billing_version == version + 1
+    assert engine.has_billing_access("member")
+
+    # New members of a child count against the root's user limit
+    assert engine.get(root.id).can_add_user("tiered_plan")
+    session.add(UserCompany(user_id="third", company_id=child.id))
+    session.commit()
+    assert engine.get(root.id).user_count == 3
+    assert not engine.get(root.id).can_add_user("tiered_plan")
+
+    # Members' usage is charged to the root
+    engine.charge(session, child.id, 200)
+    session.commit()
+    session.refresh(root)
+    session.refresh(child)
+    assert root.tokens_used_this_period == 200 and child.tokens_used_this_period == 0
+
+    # Writes outside the ORM are caught by the reconcile
+    session.execute(
+        update(Company)
+        .where(Company.id == root.id)
+        .values(token_balance_usd=0, billing_version=Company.billing_version + 1)
+    )
+    session.commit()
+    assert engine.has_billing_access("member")
+    assert engine.reconcile()["stale"] == 1
+    assert not engine.has_billing_access("member")
+    session.close()
+
+
+@pytest.mark.parametrize("pricing", [None, PRICING])
+def test_concurrent_decrements_neither_lose_updates_nor_overdraw(tmp_path, pricing):
+    url = f"sqlite:///{tmp_path / 'billing.db'}"
+    engine, factory = make_engine(pricing=pricing, url=url)
+    session = factory()
+    root = Company(
+        name="root",
+        plan_id="team",
+        # Tiered: the first 1000 tokens are included, then 40 of balance
+        token_balance=1045 if pricing is None else 40,
+        current_period_start=utcnow(),
+    )
+    session.add(root)
+    session.commit()
+    root_id = root.id
+    session.close()
+
+    results = []
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        for _ in range(15):
+            session = factory()
+            try:
+                engine.charge(session, root_id, 10)
+                session.commit()
+                results.append(True)
+            except HTTPException as e:
+                assert e.status_code == 402
+                session.rollback()
+                results.append(False)
+            finally:
+                session.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    session = factory()
+    root = session.get(Company, root_id)
+    # 104 charges of 10 are paid for, whichever way they interleave
+    assert results.count(True) == 104
+    assert root.token_balance == (5 if pricing is None else 0)
+    assert root.tokens_used_total == 1040
+    if pricing is not None:
+        assert root.tokens_used_this_period == 1040
+    assert root.billing_version == 104
+    session.close()
+
+
+def test_entitlement_round_trips_and_settings_are_cached():
+    engine, _ = make_engine()
+    entitlement = Entitlement(
+        company_id="c",
+        version=3,
+        plan_id="team",
+        plan_devices=2,
+        addon_devices=1,
+        device_count=3,
+        plan_storage_bytes=100,
+        storage_used_bytes=90,
+        period_start=datetime(2026, 1, 31),
+    )
+    assert Entitlement.from_cache(entitlement.to_cache()) == entitlement
+    assert not entitlement.device_check()["can_add"]
+    assert entitlement.storage_check(10)["can_add"]
+    assert not entitlement.storage_check(11)["can_add"]
+    assert not entitlement.period_elapsed(datetime(2026, 2, 27))
+    assert entitlement.period_elapsed(datetime(2026, 2, 28))
+
+    # An older version never replaces a newer cached one
+    engine.store(entitlement)
+    engine.store(Entitlement(company_id="c", version=2))
+    assert engine.cache.get(engine.cache_key("c"))["version"] == 3
+
+    assert engine.billing_enabled() and engine.billing_enabled()
+    assert engine.load_token_price.calls == 1
+    engine.invalidate_settings()
+    assert engine.token_price() == 5.0 and engine.load_token_price.calls == 2
@@ -0,0 +1,205 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+BENCHMARKS = os.path.join(PROJECT_ROOT, "tests", "benchmarks")
+if BENCHMARKS not in sys.path:
+    sys.path.insert(0, BENCHMARKS)
+
+from agixt.HybridRetrieval import (  # noqa: E402
+    MemoryFilters,
+    ensure_memory_text_index,
+    fts5_match_expression,
+    lexical_search,
+    query_terms,
+    rank_by_similarity,
+    reciprocal_rank_fusion,
+    term_coverage,
+)
+from retrieval_eval import MEMORY_TABLE, evaluate  # noqa: E402
+
+AGENT = "agent-1"
+CONVERSATION = "conv-1"
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'memories.db'}")
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        session.execute(text(MEMORY_TABLE))
+        yield session
+
+
+def add_memory(session, memory_id, body, **columns):
+    values = {
+        "id": memory_id,
+        "agent_id": AGENT,
+        "conversation_id": None,
+        "text": body,
+        "external_source": "user input",
+        "timestamp": datetime(2024, 6, 1),
+    }
+    values.update(columns)
+    session.execute(
+        text(
+            "INSERT INTO memory (id, agent_id, conversation_id, text, "
+            "external_source, timestamp) VALUES (:id, :agent_id, "
+            ":conversation_id, :text, :external_source, :timestamp)"
+        ),
+        values,
+    )
+    session.commit()
+
+
+def ids(results):
+    return [memory_id for memory_id, _ in results]
+
+
+def test_query_terms_keep_identifiers():
+    assert query_terms("What does ERR_CONN_RESET mean for user-029?") == [
+        "err_conn_reset",
+        "mean",
+        "user-029",
+    ]
+    assert query_terms("the a of") == []
+    assert fts5_match_expression(['say "hi"', "v1.2"]) == '"say ""hi""" OR "v1.2"'
+
+
+def test_term_coverage():
+    terms = query_terms("ERR_CONN_RESET retry policy for user-029")
+    assert term_coverage(terms, "Retry policy: back off on ERR_CONN_RESET") == 0.75
+    assert term_coverage(terms, "The user-029 ticket") == 0.25
+    assert term_coverage(["user", "029"], "assigned to user-029") == 1.0
+    assert term_coverage([], "anything") == 0.0
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]])
+    # c appears in both lists and overtakes a, which is first in only one
+    assert ids(fused)[:2] == ["c", "a"]
+    assert set(ids(fused)) == {"a", "b", "c", "d"}
+    weighted = reciprocal_rank_fusion([["a"], ["b"]], weights=[1.0, 2.0])
+    assert ids(weighted) == ["b", "a"]
+
+
+def test_rank_by_similarity():
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = [
+        ("orthogonal", [0.0, 1.0, 0.0]),
+        ("close", [0.9, 0.1, 0.0]),
+        ("exact", [2.0, 0.0, 0.0]),
+        ("wrong-size", [1.0, 0.0]),
+        ("missing", None),
+    ]
+    ranked = rank_by_similarity(query, candidates, limit=5, min_score=0.1)
+    assert ids(ranked) == ["exact", "close"]
+    assert ranked[0][1] == pytest.approx(1.0)
+    assert rank_by_similarity(query, candidates, limit=1) == ranked[:1]
+
+
+def test_fts_index_backfills_and_tracks_changes(session):
+    add_memory(session, "m1", "Retry when the gateway returns ERR_CONN_RESET")
+    ensure_memory_text_index(session)
+    assert ids(lexical_search(session, "ERR_CONN_RESET", AGENT)) == ["m1"]
+
+    add_memory(session, "m2", "Ticket OPS-1187 tracks the 502 errors")
+    assert ids(lexical_search(session, "OPS-1187 status", AGENT)) == ["m2"]
+
+    session.execute(text("UPDATE memory SET text = 'nothing here' WHERE id = 'm1'"))
+    session.execute(text("DELETE FROM memory WHERE id = 'm2'"))
+    session.commit()
+    assert lexical_search(session, "ERR_CONN_RESET OPS-1187", AGENT) == []
+
+    # Creating the index again is a no-op
+    ensure_memory_text_index(session)
+    assert ids(lexical_search(session, "nothing", AGENT)) == ["m1"]
+
+
+def test_lexical_search_ranks_and_scopes(session):
+    ensure_memory_text_index(session)
+    add_memory(session, "core", "Invoice INV-2024-0042 was refunded")
+    add_memory(
+        session,
+        "conversation",
+        "Refund for invoice INV-2024-0042 confirmed with the customer",
+        conversation_id=CONVERSATION,
+    )
+    add_memory(session, "other-agent", "Invoice INV-2024-0042", agent_id="agent-2")
+    add_memory(session, "unrelated", "Invoices are sent monthly")
+
+    assert ids(lexical_search(session, "INV-2024-0042", AGENT)) == ["core"]
+    results = lexical_search(
+        session, "invoice INV-2024-0042 refunded", AGENT, CONVERSATION
+    )
+    assert set(ids(results)) == {"core", "conversation"}
+    assert results[0][1] >= results[1][1]
+    assert lexical_search(session, "the of and", AGENT) == []
+
+
+def test_lexical_search_filters(session):
+    ensure_memory_text_index(session)
+    add_memory(
+        session,
+        "runbook",
+        "restart the cache cluster",
+        external_source="file runbooks/cache.md",
+        timestamp=datetime(2024, 1, 10),
+    )
+    add_memory(
+        session,
+        "ticket",
+        "cache cluster restart requested",
+        external_source="https://tracker.example.com/OPS-1",
+        timestamp=datetime(2024, 5, 10),
+    )
+    add_memory(
+        session,
+        "note",
+        "cache looked slow today",
+        external_source="user_input",
+        timestamp=datetime(2024, 9, 10),
+    )
+
+    def search(**filters):
+        return set(
+            ids(
+                lexical_search(
+                    session, "cache", AGENT, filters=MemoryFilters(**filters)
+                )
+            )
+        )
+
+    assert search() == {"runbook", "ticket", "note"}
+    assert search(external_sources=["file runbooks/cache.md", "user_input"]) == {
+        "runbook",
+        "note",
+    }
+    assert search(external_source_prefix="https://") == {"ticket"}
+    # The prefix is matched literally, so "_" is not a wildcard
+    assert search(external_source_prefix="user_") == {"note"}
+    assert search(external_source_prefix="userXinput") == set()
+    assert search(since=datetime(2024, 3, 1)) == {"ticket", "note"}
+    assert search(since=datetime(2024, 3, 1), until=datetime(2024, 6, 1)) == {"ticket"}
+
+
+def test_eval_harness_hybrid_beats_single_modes():
+    report = evaluate(embedder="hashing")
+    assert set(report) == {"vector", "lexical", "hybrid"}
+    for mode in report.values():
+        assert 0.0 <= mode["recall@5"] <= 1.0 and mode["p50_ms"] > 0
+    hybrid = report["hybrid"]
+    assert hybrid["recall@5"] >= report["vector"]["recall@5"]
+    assert hybrid["mrr"] >= max(report["vector"]["mrr"], report["lexical"]["mrr"])
+    assert hybrid["recall@5_by_kind"]["exact"] == 1.0
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+import agixt.InternalInvocation as invocation  # noqa: E402
+from agixt.InternalInvocation import (  # noqa: E402
+    InvocationDepthExceeded,
+    InvocationTimeout,
+    current_depth,
+    get_invocation_stats,
+    invocation_scope,
+    invoke,
+    invoke_sync,
+    remaining_time,
+)
+
+PROVIDER_LATENCY = 0.05
+
+
+class FakeProvider:
+    """Stands in for an LLM provider: fixed latency, tracks concurrency"""
+
+    def __init__(self, latency=PROVIDER_LATENCY):
+        self.latency = latency
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+        self.cancelled = 0
+        self.loops = set()
+
+    async def inference(self, prompt):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.loops.add(id(asyncio.get_running_loop()))
+        try:
+            await asyncio.sleep(self.latency)
+            return f"answer to {prompt}"
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+
+class FakeAgents:
+    """Agents that may delegate to other agents, like InternalClient.prompt_agent"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    async def _prompt(self, prompt, delegate_to=()):
+        answers = [await self.provider.inference(prompt)]
+        if delegate_to:
+            answers += await asyncio.gather(
+                *[self.prompt_async(sub) for sub in delegate_to]
+            )
+        return " | ".join(answers)
+
+    async def prompt_async(self, prompt, delegate_to=(), timeout=None):
+        return await invoke(lambda: self._prompt(prompt, delegate_to), timeout=timeout)
+
+    def prompt(self, prompt, delegate_to=(), timeout=None):
+        return invoke_sync(lambda: self._prompt(prompt, delegate_to), timeout=timeout)
+
+
+def test_nested_async_calls_run_on_callers_loop():
+    provider = FakeProvider()
+    agents = FakeAgents(provider)
+
+    async def scenario():
+        result = await agents.prompt_async("plan", delegate_to=["research", "write"])
+        assert provider.loops == {id(asyncio.get_running_loop())}
+        return result
+
+    assert asyncio.run(scenario()) == (
+        "answer to plan | answer to research | answer to write"
+    )
+
+
+def test_sync_callers_share_one_background_loop():
+    provider = FakeProvider()
+    agents = FakeAgents(provider)
+    threads_before = threading.active_count()
+
+    def caller(i):
+        return agents.prompt(f"q{i}")
+
+    results = []
+    workers = [
+        threading.Thread(target=lambda i=i: results.append(caller(i)))
+        for i in range(20)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(results) == sorted(f"answer to q{i}" for i in range(20))
+    assert len(provider.loops) == 1
+    bridge_threads = [
+        t for t in threading.enumerate() if t.name == "agixt-invocation-loop"
+    ]
+    assert len(bridge_threads) == 1
+    assert threading.active_count() <= threads_before + 1
+
+
+def test_sync_call_from_running_loop_does_not_spawn_threads_per_call():
+    provider = FakeProvider(latency=0.01)
+    agents = FakeAgents(provider)
+
+    async def scenario():
+        agents.prompt("warm up")
+        before = threading.active_count()
+        peak = before
+        for i in range(30):
+            # Old behaviour: a ThreadPoolExecutor and asyncio.run per call
+            agents.prompt(f"q{i}")
+            peak = max(peak, threading.active_count())
+        return before, peak
+
+    before, peak = asyncio.run(scenario())
+    assert peak == before
+
+
+def test_concurrency_limit_per_depth_under_load(monkeypatch):
+    monkeypatch.setattr(invocation, "MAX_CONCURRENT_NESTED_CALLS", 4)
+    provider = FakeProvider()
+    agents = FakeAgents(provider)
+
+    async def scenario():
+        start = time.perf_counter()
+        # Each top-level call fans out to three children; parents hold depth-0
+        # slots while their children use depth-1 slots, so nothing deadlocks.
+        results = await asyncio.gather(
+            *[
+                agents.prompt_async(f"p{i}", delegate_to=["a", "b", "c"])
+                for i in range(12)
+            ]
+        )
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(scenario())
+    assert len(results) == 12
+    assert provider.calls == 48
+    # At most 4 parents plus 4 children are in flight at once
+    assert provider.peak <= 8
+    # 12 parents in batches of 4, each followed by its children
+    assert elapsed < 12 * 2 * PROVIDER_LATENCY
+    print(f"\n48 nested calls in {elapsed * 1000:.0f} ms, peak {provider.peak}")
+
+
+def test_parent_deadline_propagates_to_children():
+    provider = FakeProvider(latency=1.0)
+    agents = FakeAgents(provider)
+
+    async def scenario():
+        with invocation_scope(timeout=0.2):
+            assert 0 < remaining_time() <= 0.2
+            start = time.perf_counter()
+            with pytest.raises(InvocationTimeout):
+                # The child asks for 10s but cannot outlive its parent
+                await agents.prompt_async("slow", timeout=10)
+            return time.perf_counter() - start
+
+    assert asyncio.run(scenario()) < 0.5
+    assert provider.cancelled == 1
+    assert remaining_time() is None
+
+
+def test_parent_deadline_reaches_sync_bridge():
+    provider = FakeProvider(latency=1.0)
+    agents = FakeAgents(provider)
+    with invocation_scope(timeout=0.2):
+        with pytest.raises(InvocationTimeout):
+            agents.prompt("slow")
+    assert get_invocation_stats()["timeouts"] >= 1
+
+
+def test_cancelling_parent_task_cancels_nested_calls():
+    provider = FakeProvider(latency=5.0)
+    agents = FakeAgents(provider)
+
+    async def scenario():
+        task = asyncio.create_task(agents.prompt_async("parent", delegate_to=["c"]))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert provider.cancelled == 1
+    assert provider.active == 0
+
+
+def test_stopped_interaction_cancels_blocked_sync_caller():
+    provider = FakeProvider(latency=5.0)
+    agents = FakeAgents(provider)
+    stopped = threading.Event()
+    threading.Timer(0.2, stopped.set).start()
+
+    start = time.perf_counter()
+    with invocation_scope(cancel_check=stopped.is_set):
+        with pytest.raises(asyncio.CancelledError):
+            agents.prompt("long running")
+    assert time.perf_counter() - start < 1.0
+    time.sleep(0.1)
+    assert provider.cancelled == 1
+
+
+def test_runaway_recursion_is_bounded(monkeypatch):
+    monkeypatch.setattr(invocation, "MAX_NESTING_DEPTH", 3)
+    depths = []
+
+    async def recurse():
+        depths.append(current_depth())
+        return await invoke(recurse)
+
+    with pytest.raises(InvocationDepthExceeded):
+        asyncio.run(invoke(recurse))
+    assert depths == [1, 2, 3]
@@ -0,0 +1,395 @@
+import asyncio
+import json
+import os
+import sys
+import textwrap
+
+import pytest
+from aiohttp import web
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.mcp_client import (  # noqa: E402
+    MCPConnectionError,
+    MCPSessionManager,
+    MCPTimeoutError,
+    parse_server_config,
+)
+
+# A tiny stdio MCP server. Requests are handled on threads so responses can
+# come back out of order, like a real server under concurrent load.
+STDIO_SERVER = textwrap.dedent(
+    """
+    import json, os, sys, threading, time
+
+    lock = threading.Lock()
+    tools = [{"name": n, "inputSchema": {"type": "object"}}
+             for n in ("echo", "sleep", "crash", "add_tool", "stats")]
+    state = {"list_calls": 0, "cancelled": []}
+
+    def send(message):
+        with lock:
+            sys.stdout.write(json.dumps(message) + "\\n")
+            sys.stdout.flush()
+
+    def handle(message):
+        method = message["method"]
+        params = message.get("params", {})
+        if method == "initialize":
+            result = {
+                "protocolVersion": params["protocolVersion"],
+                "capabilities": {"tools": {"listChanged": True}},
+                "serverInfo": {"name": "echo", "version": "1.0"},
+            }
+        elif method == "tools/list":
+            state["list_calls"] += 1
+            result = {"tools": list(tools)}
+        elif method == "tools/call":
+            name, args = params["name"], params.get("arguments", {})
+            if name == "echo":
+                text = args["text"]
+            elif name == "sleep":
+                time.sleep(args["seconds"])
+                text = "slept"
+            elif name == "crash":
+                os._exit(1)
+            elif name == "add_tool":
+                tools.append({"name": args["name"], "inputSchema": {}})
+                send({"jsonrpc": "2.0",
+                      "method": "notifications/tools/list_changed"})
+                text = "added"
+            else:
+                text = json.dumps(dict(state, pid=os.getpid()))
+            result = {"content": [{"type": "text", "text": text}]}
+        else:
+            send({"jsonrpc": "2.0", "id": message["id"],
+                  "error": {"code": -32601, "message": "not found"}})
+            return
+        send({"jsonrpc": "2.0", "id": message["id"], "result": result})
+
+    for line in sys.stdin:
+        message = json.loads(line)
+        if "id" not in message:
+            if message["method"] == "notifications/cancelled":
+                state["cancelled"].append(message["params"]["requestId"])
+            continue
+        threading.Thread(target=handle, args=(message,), daemon=True).start()
+    """
+)
+
+
+@pytest.fixture
+def stdio_config(tmp_path):
+    script = tmp_path / "echo_server.py"
+    script.write_text(STDIO_SERVER)
+    return {"transport": "stdio", "command": sys.executable, "args": [str(script)]}
+
+
+def text_of(content):
+    return content[0]["text"]
+
+
+async def server_stats(manager, config):
+    return json.loads(text_of(await manager.call_tool(config, "stats")))
+
+
+class StreamableHTTPServer:
+    """In-process streamable HTTP MCP server built on aiohttp"""
+
+    def __init__(self):
+        self.sessions = set()
+        self.sessions_created = 0
+        self.deleted = []
+        self.cancelled = []
+        self.list_calls = 0
+        self.tools = [{"name": "echo"}, {"name": "sleep"}]
+        self.streams = []
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/mcp", self.handle_post)
+        app.router.add_get("/mcp", self.handle_get)
+        app.router.add_delete("/mcp", self.handle_delete)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return {"transport": "http", "endpoint_url": f"http://127.0.0.1:{port}/mcp"}
+
+    async def stop(self):
+        for stream in self.streams:
+            stream.force_close()
+        await self.runner.cleanup()
+
+    async def push(self, message):
+        for stream in self.streams:
+            await stream.write(f"data: {json.dumps(message)}\n\n".encode())
+
+    async def handle_post(self, request):
+        message = await request.json()
+        session_id = request.headers.get("Mcp-Session-Id")
+        if message.get("method") == "initialize":
+            self.sessions_created += 1
+            session_id = f"session-{self.sessions_created}"
+            self.sessions.add(session_id)
+            result = {
+                "protocolVersion": message["params"]["protocolVersion"],
+                "capabilities": {"tools": {"listChanged": True}},
+                "serverInfo": {"name": "http-echo", "version": "1.0"},
+            }
+            return web.json_response(
+                {"jsonrpc": "2.0", "id": message["id"], "result": result},
+                headers={"Mcp-Session-Id": session_id},
+            )
+        if session_id not in self.sessions:
+            return web.Response(status=404)
+        assert request.headers["MCP-Protocol-Version"]
+        if "id" not in message:
+            if message["method"] == "notifications/cancelled":
+                self.cancelled.append(message["params"]["requestId"])
+            return web.Response(status=202)
+        if message["method"] == "tools/list":
+            self.list_calls += 1
+            return web.json_response(
+                {"jsonrpc": "2.0", "id": message["id"], "result": {"tools": self.tools}}
+            )
+        # Tool calls answer on an SSE stream, with a progress event first
+        args = message["params"].get("arguments", {})
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+        progress = {"jsonrpc": "2.0", "method": "notifications/progress"}
+        await stream.write(f"data: {json.dumps(progress)}\n\n".encode())
+        if message["params"]["name"] == "sleep":
+            await asyncio.sleep(args["seconds"])
+            text = "slept"
+        else:
+            text = args["text"]
+        response = {
+            "jsonrpc": "2.0",
+            "id": message["id"],
+            "result": {"content": [{"type": "text", "text": text}]},
+        }
+        await stream.write(f"event: message\ndata: {json.dumps(response)}\n\n".encode())
+        await stream.write_eof()
+        return stream
+
+    async def handle_get(self, request):
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+        self.streams.append(stream)
+        await stream.write(b": connected\n\n")
+        while request.transport is not None and not request.transport.is_closing():
+            await asyncio.sleep(0.05)
+        return stream
+
+    async def handle_delete(self, request):
+        session_id = request.headers.get("Mcp-Session-Id")
+        self.sessions.discard(session_id)
+        self.deleted.append(session_id)
+        return web.Response(status=200)
+
+
+def test_stdio_sessions_are_pooled_and_handle_concurrent_calls(stdio_config):
+    async def scenario():
+        manager = MCPSessionManager()
+        try:
+            results = await asyncio.gather(
+                *[
+                    manager.call_tool(stdio_config, "echo", {"text": f"msg-{i}"})
+                    for i in range(25)
+                ]
+            )
+            assert [text_of(r) for r in results] == [f"msg-{i}" for i in range(25)]
+            first = await manager.get_client(stdio_config)
+            assert await manager.get_client(dict(stdio_config)) is first
+            assert manager.get_stats()["connects"] == 1
+            assert manager.get_stats()["sessions"] == 1
+        finally:
+            await manager.close_all()
+
+    asyncio.run(scenario())
+
+
+def test_stdio_deadline_sends_cancellation(stdio_config):
+    async def scenario():
+        manager = MCPSessionManager()
+        try:
+            client = await manager.get_client(stdio_config)
+            with pytest.raises(MCPTimeoutError):
+                await client.call_tool("sleep", {"seconds": 2}, timeout=0.2)
+            # The session survives and the server heard about the cancellation
+            stats = await server_stats(manager, stdio_config)
+            assert len(stats["cancelled"]) == 1
+            assert client.transport._pending_requests == {}
+
+            task = asyncio.create_task(
+                manager.call_tool(stdio_config, "sleep", {"seconds": 2})
+            )
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.1)
+            stats = await server_stats(manager, stdio_config)
+            assert len(stats["cancelled"]) == 2
+        finally:
+            await manager.close_all()
+
+    asyncio.run(scenario())
+
+
+def test_tool_listing_is_cached_until_list_changed(stdio_config):
+    async def scenario():
+        manager = MCPSessionManager()
+        try:
+            tools = await asyncio.gather(
+                *[manager.list_tools(stdio_config) for _ in range(5)]
+            )
+            assert all(len(t) == 5 for t in tools)
+            assert (await server_stats(manager, stdio_config))["list_calls"] == 1
+
+            await manager.call_tool(stdio_config, "add_tool", {"name": "extra"})
+            await asyncio.sleep(0.1)
+            names = [t["name"] for t in await manager.list_tools(stdio_config)]
+            assert "extra" in names
+            assert (await server_stats(manager, stdio_config))["list_calls"] == 2
+        finally:
+            await manager.close_all()
+
+    asyncio.run(scenario())
+
+
+def test_crashed_stdio_server_is_restarted(stdio_config):
+    async def scenario():
+        manager = MCPSessionManager(restart_backoff=0.01)
+        try:
+            before = await server_stats(manager, stdio_config)
+            pending = asyncio.create_task(
+                manager.call_tool(stdio_config, "sleep", {"seconds": 5})
+            )
+            await asyncio.sleep(0.1)
+            with pytest.raises(MCPConnectionError):
+                await manager.call_tool(stdio_config, "crash")
+            # In-flight requests fail fast instead of hanging forever
+            with pytest.raises(MCPConnectionError):
+                await asyncio.wait_for(pending, 2)
+
+            after = await server_stats(manager, stdio_config)
+            assert after["pid"] != before["pid"]
+            assert manager.get_stats()["restarts"] == 1
+        finally:
+            await manager.close_all()
+
+    asyncio.run(scenario())
+
+
+def test_repeated_crashes_give_up():
+    async def scenario():
+        config = {
+            "transport": "stdio",
+            "command": sys.executable,
+            "args": ["-c", "import sys; sys.exit(1)"],
+        }
+        manager = MCPSessionManager(max_restarts=0)
+        with pytest.raises(MCPConnectionError):
+            await manager.get_client(config)
+        assert manager.get_stats()["sessions"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_streamable_http_session_under_concurrent_calls():
+    async def scenario():
+        server = StreamableHTTPServer()
+        config = await server.start()
+        manager = MCPSessionManager()
+        try:
+            results = await asyncio.gather(
+                *[
+                    manager.call_tool(config, "echo", {"text": f"http-{i}"})
+                    for i in range(20)
+                ]
+            )
+            assert [text_of(r) for r in results] == [f"http-{i}" for i in range(20)]
+            client = await manager.get_client(config)
+            assert client.transport.session_id == "session-1"
+
+            with pytest.raises(MCPTimeoutError):
+                await client.call_tool("sleep", {"seconds": 2}, timeout=0.2)
+            assert len(server.cancelled) == 1
+
+            await manager.list_tools(config)
+            await manager.list_tools(config)
+            assert server.list_calls == 1
+            # Change notifications arrive on the standalone GET stream
+            for _ in range(50):
+                if server.streams:
+                    break
+                await asyncio.sleep(0.02)
+            server.tools.append({"name": "extra"})
+            await server.push(
+                {"jsonrpc": "2.0", "method": "notifications/tools/list_changed"}
+            )
+            await asyncio.sleep(0.1)
+            assert len(await manager.list_tools(config)) == 3
+            assert server.list_calls == 2
+        finally:
+            await manager.close_all()
+            await server.stop()
+        assert server.deleted == ["session-1"]
+
+    asyncio.run(scenario())
+
+
+def test_expired_http_session_reconnects():
+    async def scenario():
+        server = StreamableHTTPServer()
+        config = await server.start()
+        manager = MCPSessionManager(restart_backoff=0.01)
+        try:
+            await manager.call_tool(config, "echo", {"text": "a"})
+            server.sessions.clear()
+            with pytest.raises(MCPConnectionError):
+                await manager.call_tool(config, "echo", {"text": "b"})
+            result = await manager.call_tool(config, "echo", {"text": "c"})
+            assert text_of(result) == "c"
+            assert (await manager.get_client(config)).transport.session_id == (
+                "session-2"
+            )
+        finally:
+            await manager.close_all()
+            await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_parse_server_config(monkeypatch):
+    assert parse_server_config("https://example.com/mcp") == {
+        "transport": "http",
+        "endpoint_url": "https://example.com/mcp",
+    }
+    assert parse_server_config("https://example.com/sse")["transport"] == "sse"
+    browser = {"transport": "stdio", "command": "npx", "args": ["-y", "@scope/server"]}
+    monkeypatch.setenv("MCP_SERVERS", json.dumps({"browser": browser}))
+    assert parse_server_config(" browser ") == browser
+
+
+@pytest.mark.parametrize(
+    "server", ["npx -y @scope/server --flag 'a b'", "sh -c 'touch /tmp/x'", "browser"]
+)
+def test_command_strings_are_not_run_as_stdio_servers(server, monkeypatch):
+    monkeypatch.delenv("MCP_SERVERS", raising=False)
+    with pytest.raises(ValueError):
+        parse_server_config(server)
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await MCPSessionManager().call_method(server, "tools/list")
+
+    asyncio.run(scenario())
@@ -0,0 +1,301 @@
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sqlalchemy import Column, DateTime, String, Text, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.types import TypeDecorator
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.MemoryCompaction import (  # noqa: E402
+    PROVENANCE_PREFIX,
+    CompactionResult,
+    MemoryCompactionService,
+    compact_collection,
+    content_hash,
+    merge_provenance,
+    plan_compaction,
+)
+from agixt.MemoryTransfer import decode_embedding, encode_embedding  # noqa: E402
+
+AGENT = "agent-1"
+BASE_TIME = datetime(2024, 6, 1)
+
+Base = declarative_base()
+
+
+class EmbeddingColumn(TypeDecorator):
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return encode_embedding(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_embedding(value)
+
+
+class Memory(Base):
+    __tablename__ = "memory"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    agent_id = Column(String, nullable=False)
+    conversation_id = Column(String, nullable=True)
+    embedding = Column(EmbeddingColumn)
+    text = Column(Text, nullable=False)
+    external_source = Column(String)
+    description = Column(Text)
+    timestamp = Column(DateTime)
+    additional_metadata = Column(Text)
+    content_hash = Column(String)
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def row(text, embedding=None, age=0, source="user input", metadata=None):
+    return SimpleNamespace(
+        id=str(uuid.uuid4()),
+        text=text,
+        embedding=embedding,
+        timestamp=BASE_TIME - timedelta(days=age),
+        external_source=source,
+        additional_metadata=metadata,
+        content_hash=None,
+    )
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'memories.db'}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        yield session
+
+
+def test_content_hash_normalises_whitespace_and_case():
+    assert content_hash("Hello   World\n") == content_hash("hello world")
+    assert content_hash("hello world") != content_hash("hello, world")
+
+
+def test_plan_groups_exact_duplicates_keeping_newest():
+    old = row("The cache TTL is 5 minutes", age=3)
+    newer = row("the cache ttl is  5 minutes", age=1)
+    newest = row("The cache TTL is 5 minutes", age=0)
+    other = row("Deploys happen on Tuesdays")
+    groups = plan_compaction([old, other, newer, newest], threshold=1.0)
+    assert len(groups) == 1
+    assert groups[0].keep is newest
+    assert {r.id for r in groups[0].exact} == {old.id, newer.id}
+    assert groups[0].near == []
+
+
+def test_plan_groups_near_duplicates_by_threshold():
+    rng = np.random.default_rng(0)
+    base = unit(rng.normal(size=64))
+    close = unit(base + 0.01 * rng.normal(size=64))
+    far = unit(rng.normal(size=64))
+    keep = row("a", base, age=0)
+    near = row("a!", close, age=1)
+    distinct = row("b", far, age=2)
+    groups = plan_compaction([near, distinct, keep], threshold=0.97)
+    assert len(groups) == 1
+    assert groups[0].keep is keep
+    assert groups[0].near == [near]
+    # Above the similarity of the pair nothing is merged
+    assert plan_compaction([near, distinct, keep], threshold=0.99999) == []
+
+
+def test_plan_only_groups_rows_of_the_same_source():
+    vector = unit([1.0, 0.0, 0.0])
+    from_file = row("The cache TTL is 5 minutes", vector, source="file a.md")
+    from_url = row("The cache TTL is 5 minutes", vector, age=1, source="https://x.io")
+    same_file = row("the cache ttl is 5 minutes", vector, age=2, source="file a.md")
+    groups = plan_compaction([from_url, same_file, from_file], threshold=0.97)
+    assert len(groups) == 1
+    assert groups[0].keep is from_file and groups[0].exact == [same_file]
+
+
+def test_plan_keeps_near_duplicates_with_different_numbers():
+    vector = unit([1.0, 0.0, 0.0])
+    three = row("Failed jobs are retried 3 times", vector)
+    five = row("Failed jobs are retried 5 times", vector, age=1)
+    again = row("Failed jobs are retried 3 times.", vector, age=2)
+    groups = plan_compaction([three, five, again], threshold=0.97)
+    assert len(groups) == 1
+    assert groups[0].keep is three and groups[0].near == [again]
+
+
+def test_plan_absorbs_exact_group_into_near_match():
+    vector = unit([1.0, 0.0, 0.0])
+    keep = row("first wording", vector, age=0)
+    copy_a = row("second wording", vector, age=1)
+    copy_b = row("Second  wording", vector, age=2)
+    groups = plan_compaction([copy_b, copy_a, keep], threshold=0.97)
+    assert len(groups) == 1
+    assert groups[0].keep is keep
+    assert {r.id for r in groups[0].duplicates} == {copy_a.id, copy_b.id}
+
+
+def test_plan_on_duplicate_heavy_corpus():
+    rng = np.random.default_rng(1)
+    rows = []
+    distinct = 300
+    for index in range(distinct):
+        vector = unit(rng.normal(size=128))
+        rows.append(row(f"chunk {index}", vector, age=index % 7))
+        # Two exact copies and one lightly perturbed copy of every chunk
+        rows.append(row(f"Chunk  {index}", vector, age=10))
+        rows.append(row(f"chunk {index}", vector, age=11))
+        rows.append(
+            row(
+                f"chunk {index} (edited)",
+                unit(vector + 0.005 * rng.normal(size=128)),
+                age=12,
+            )
+        )
+    groups = plan_compaction(rows, threshold=0.97)
+    assert len(groups) == distinct
+    removed = sum(len(group.duplicates) for group in groups)
+    assert removed == len(rows) - distinct
+    # Without near matching only the exact copies go
+    exact_only = plan_compaction(rows, threshold=0.97, max_near_rows=10)
+    assert sum(len(g.duplicates) for g in exact_only) == 2 * distinct
+
+
+def test_merge_provenance_records_sources_once():
+    keep = row("body", source="https://example.com/a", metadata="body")
+    duplicates = [
+        row("body", age=2, source="file notes.md"),
+        row("body", age=3, source="file notes.md"),
+        row("body", age=4, source="https://example.com/a"),
+        row(
+            "body",
+            age=5,
+            source="user input",
+            metadata=f"body\n{PROVENANCE_PREFIX}search: cache ttl (2024-01-01)",
+        ),
+    ]
+    merged = merge_provenance(keep, duplicates)
+    body, provenance = merged.split("\n")
+    assert body == "body"
+    assert provenance == (
+        f"{PROVENANCE_PREFIX}file notes.md (2024-05-30); "
+        "user input (2024-05-27); search: cache ttl (2024-01-01)"
+    )
+    # Merging again keeps a single provenance line
+    again = merge_provenance(
+        SimpleNamespace(**{**vars(keep), "additional_metadata": merged}),
+        [row("body", source="file other.md", age=1)],
+    )
+    assert again.count(PROVENANCE_PREFIX) == 1
+    assert again.endswith("; file other.md (2024-05-31)")
+    assert merge_provenance(keep, []) == "body"
+
+
+def test_compact_collection_removes_duplicates(session):
+    rng = np.random.default_rng(2)
+    vectors = [unit(rng.normal(size=32)) for _ in range(3)]
+    for age, (text, vector, source) in enumerate(
+        [
+            ("alpha fact", vectors[0], "file a.md"),
+            ("Alpha  fact", vectors[0], "file a.md"),
+            ("beta fact", vectors[1], "user input"),
+            ("beta fact.", unit(vectors[1] + 0.001), "user input"),
+            ("gamma fact", vectors[2], "user input"),
+            # Another source's copy stays, so deleting file a.md keeps it
+            ("alpha fact", vectors[0], "file b.md"),
+        ]
+    ):
+        session.add(
+            Memory(
+                agent_id=AGENT,
+                text=text,
+                embedding=vector,
+                external_source=source,
+                additional_metadata=text,
+                timestamp=BASE_TIME - timedelta(days=age),
+            )
+        )
+    # Same text in a conversation and for another agent is left alone
+    session.add(Memory(agent_id=AGENT, conversation_id="c1", text="alpha fact"))
+    session.add(Memory(agent_id="agent-2", text="alpha fact"))
+    session.commit()
+
+    preview = compact_collection(session, Memory, AGENT, dry_run=True)
+    assert preview.removed == 2 and preview.dry_run
+    assert session.query(Memory).count() == 8
+    assert session.query(Memory).filter(Memory.content_hash.isnot(None)).count() == 0
+
+    result = compact_collection(session, Memory, AGENT)
+    assert result.scanned == 6
+    assert (result.exact_duplicates, result.near_duplicates) == (1, 1)
+    assert result.removed == 2 and result.merged_groups == 2
+    assert result.hashes_backfilled == 6
+    remaining = sorted(
+        (m.text, m.external_source)
+        for m in session.query(Memory).filter_by(agent_id=AGENT, conversation_id=None)
+    )
+    assert remaining == [
+        ("alpha fact", "file a.md"),
+        ("alpha fact", "file b.md"),
+        ("beta fact", "user input"),
+        ("gamma fact", "user input"),
+    ]
+    assert session.query(Memory).count() == 6
+
+    # A second pass finds nothing left to do
+    assert compact_collection(session, Memory, AGENT).removed == 0
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def set_if_not_exists(self, key, value, ttl=None):
+        return self.values.setdefault(key, value) == value
+
+
+def test_service_skips_unchanged_collections():
+    collections = [(AGENT, None, 4), (AGENT, "c1", 2)]
+    compacted = []
+
+    class Service(MemoryCompactionService):
+        def _collections(self):
+            return list(collections)
+
+        def _compact(self, agent_id, conversation_id, dry_run=False):
+            compacted.append((agent_id, conversation_id))
+            removed = 1 if conversation_id is None else 0
+            return CompactionResult(scanned=4, removed=removed)
+
+    service = Service(interval=0, cache=LocalCache())
+    first = asyncio.run(service.run_once())
+    assert first.removed == 1 and len(compacted) == 2
+
+    # The core collection now holds 3 rows; only the conversation changed
+    collections[:] = [(AGENT, None, 3), (AGENT, "c1", 5)]
+    compacted.clear()
+    asyncio.run(service.run_once())
+    assert compacted == [(AGENT, "c1")]
+    stats = service.get_stats()
+    assert stats["runs"] == 2 and stats["removed"] == 1
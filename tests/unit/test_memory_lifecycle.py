@@ -0,0 +1,309 @@
+import asyncio
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, Text, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.MemoryLifecycle import (  # noqa: E402
+    EMBEDDING_ROW_BYTES,
+    LifecyclePolicy,
+    MemoryLifecycleService,
+    RetrievalStats,
+    collection_report,
+    enforce_collection,
+    plan_lifecycle,
+    resolve_policy,
+    validate_policy_document,
+)
+
+AGENT = "agent-1"
+CONVERSATION = "conversation-1"
+START = datetime(2024, 6, 1)
+
+Base = declarative_base()
+
+
+class Memory(Base):
+    __tablename__ = "memory"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    agent_id = Column(String, nullable=False)
+    conversation_id = Column(String, nullable=True)
+    embedding = Column(Text)
+    text = Column(Text, nullable=False)
+    external_source = Column(String)
+    description = Column(Text)
+    timestamp = Column(DateTime)
+    additional_metadata = Column(Text)
+    retrieval_count = Column(Integer, default=0)
+    last_retrieved_at = Column(DateTime, nullable=True)
+
+
+class Clock:
+    def __init__(self, now=START):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, days):
+        self.now += timedelta(days=days)
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def set_if_not_exists(self, key, value, ttl=None):
+        if key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+
+@pytest.fixture
+def session_factory():
+    # One shared connection, so sessions opened in worker threads see it
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def add(session, text, source="user input", written=START, conversation=None):
+    memory = Memory(
+        agent_id=AGENT,
+        conversation_id=conversation,
+        text=text,
+        external_source=source,
+        timestamp=written,
+    )
+    session.add(memory)
+    session.commit()
+    return memory.id
+
+
+def row(name, source="user input", age=0, retrieved=None, length=100):
+    return SimpleNamespace(
+        id=name,
+        external_source=source,
+        timestamp=START - timedelta(days=age),
+        last_retrieved_at=None if retrieved is None else START - timedelta(retrieved),
+        text_length=length,
+    )
+
+
+def test_policies_layer_from_server_default_to_collection():
+    server = {"conversations": {"ttl_days": {"http*": 30}}}
+    agent = {
+        "default": {"max_rows": 1000},
+        "conversations": {"ttl_days": {"file *": 90}},
+        "collections": {CONVERSATION: {"max_rows": 50, "ttl_days": {"http*": None}}},
+    }
+    core = resolve_policy([server, agent], None)
+    assert core == LifecyclePolicy(max_rows=1000)
+    other = resolve_policy([server, agent], "conversation-2")
+    assert other.ttl_days == {"http*": 30, "file *": 90}
+    assert other.max_rows == 1000
+    tuned = resolve_policy([server, agent], CONVERSATION)
+    assert tuned.ttl_days == {"file *": 90} and tuned.max_rows == 50
+    assert not resolve_policy([None], None).enforced
+
+    with pytest.raises(ValueError, match="keys"):
+        validate_policy_document({"core": {"max_age": 3}})
+    with pytest.raises(ValueError, match="sections"):
+        validate_policy_document({"everything": {}})
+    with pytest.raises(ValueError, match="negative"):
+        validate_policy_document({"default": {"max_rows": -1}})
+
+
+def test_ttl_counts_from_last_use():
+    policy = LifecyclePolicy(ttl_days={"http*": 30, "https://docs.*": 365})
+    rows = [
+        row("stale-web", "https://news.example.com/a", age=40),
+        row("fresh-web", "https://news.example.com/b", age=10),
+        row("reused-web", "https://news.example.com/c", age=40, retrieved=5),
+        row("docs", "https://docs.example.com/guide", age=40),
+        row("typed", "user input", age=400),
+    ]
+    plan = plan_lifecycle(rows, policy, START)
+    assert plan.expired == ["stale-web"]
+    assert plan.evicted == []
+    assert plan.bytes_freed == 100 + EMBEDDING_ROW_BYTES
+
+
+def test_caps_evict_least_recently_retrieved_first():
+    rows = [
+        row("hot", age=50, retrieved=1),
+        row("warm", age=50, retrieved=10),
+        row("never-old", age=30),
+        row("never-new", age=2),
+        row("big", age=1, retrieved=20, length=10_000),
+    ]
+    by_rows = plan_lifecycle(rows, LifecyclePolicy(max_rows=3), START)
+    assert by_rows.evicted == ["never-old", "never-new"]
+
+    # Everything but the big row fits in 4 * (100 + embedding) bytes
+    by_bytes = plan_lifecycle(
+        rows, LifecyclePolicy(max_bytes=4 * (100 + EMBEDDING_ROW_BYTES)), START
+    )
+    assert by_bytes.evicted == ["never-old", "never-new", "big"]
+
+
+def test_retrieval_stats_flush_in_one_batch(session_factory):
+    session = session_factory()
+    first = add(session, "first")
+    second = add(session, "second")
+    clock = Clock()
+    stats = RetrievalStats(clock)
+    stats.record([first, second])
+    clock.advance(1)
+    stats.record([first])
+    assert stats.pending == 2
+
+    statements = []
+    from sqlalchemy import event
+
+    @event.listens_for(session.bind, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE"):
+            statements.append(executemany)
+
+    assert stats.flush(session, Memory) == 2
+    assert statements == [True]
+    assert stats.pending == 0
+    session.expire_all()
+    updated = {memory.id: memory for memory in session.query(Memory)}
+    assert updated[first].retrieval_count == 2
+    assert updated[first].last_retrieved_at == START + timedelta(days=1)
+    assert updated[second].retrieval_count == 1
+    assert stats.flush(session, Memory) == 0
+
+
+def test_enforce_archives_before_deleting(session_factory):
+    session = session_factory()
+    old = add(session, "old web page", "https://a.example", START - timedelta(40))
+    add(session, "new web page", "https://b.example", START - timedelta(1))
+    policy = LifecyclePolicy(ttl_days={"http*": 30})
+    archives = []
+
+    def archiver(agent_id, conversation_id, lines):
+        archives.append((agent_id, conversation_id, [json.loads(l) for l in lines]))
+        return "archive.ndjson"
+
+    dry = enforce_collection(
+        session, Memory, AGENT, None, policy, START, archiver, dry_run=True
+    )
+    assert dry.expired == 1 and archives == []
+    assert session.query(Memory).count() == 2
+
+    result = enforce_collection(session, Memory, AGENT, None, policy, START, archiver)
+    assert (result.expired, result.archived) == (1, 1)
+    [(agent_id, collection, lines)] = archives
+    assert (agent_id, collection) == (AGENT, None)
+    assert [line["type"] for line in lines] == ["header", "memory", "footer"]
+    assert lines[1]["text"] == "old web page"
+    assert session.query(Memory).filter(Memory.id == old).count() == 0
+
+    def broken(agent_id, conversation_id, lines):
+        raise OSError("storage unavailable")
+
+    add(session, "another old page", "https://c.example", START - timedelta(60))
+    failed = enforce_collection(session, Memory, AGENT, None, policy, START, broken)
+    assert failed.archive_failures == 1 and failed.expired == 0
+    assert session.query(Memory).count() == 2
+
+
+class LocalLifecycleService(MemoryLifecycleService):
+    def __init__(self, session_factory, documents, **kwargs):
+        super().__init__(cache=LocalCache(), **kwargs)
+        self.session_factory = session_factory
+        self.documents = documents
+
+    def _session(self):
+        return self.session_factory()
+
+    def _model(self):
+        return Memory
+
+    def _policy_document(self, session, agent_id):
+        return self.documents.get(agent_id)
+
+
+def test_background_pass_with_simulated_clock(session_factory):
+    session = session_factory()
+    clock = Clock()
+    archived = []
+    service = LocalLifecycleService(
+        session_factory,
+        {AGENT: {"conversations": {"ttl_days": {"http*": 30}, "max_rows": 2}}},
+        clock=clock,
+        archiver=lambda agent, collection, lines: archived.append(list(lines)),
+    )
+    web = [
+        add(session, f"page {i}", f"https://{i}.example", START, CONVERSATION)
+        for i in range(3)
+    ]
+    notes = [
+        add(session, f"note {i}", "user input", START, CONVERSATION) for i in range(2)
+    ]
+    core = add(session, "core fact", "https://core.example", START)
+
+    clock.advance(20)
+    service.record_retrieval([web[0], notes[1]])
+    clock.advance(20)
+    result = asyncio.run(service.run_once())
+
+    # Day 40: web pages unused for 30 days expire, then the least recently
+    # retrieved note goes to respect max_rows; core has no policy
+    remaining = {memory.id for memory in session_factory().query(Memory)}
+    assert remaining == {web[0], notes[1], core}
+    assert (result.expired, result.evicted, result.archived) == (2, 1, 3)
+    assert result.collections == 1
+    assert service.get_stats()["pending_retrievals"] == 0
+
+    report = collection_report(
+        session_factory(), Memory, AGENT, [service.documents[AGENT]], clock()
+    )
+    sizes = {entry["collection"]: entry for entry in report}
+    assert sizes[CONVERSATION]["rows"] == 2
+    assert sizes[CONVERSATION]["never_retrieved"] == 0
+    assert sizes["0"]["rows"] == 1 and sizes["0"]["never_retrieved"] == 1
+    assert sizes["0"]["pending_expired"] == 0
+
+
+def test_nothing_expires_without_a_configured_policy(session_factory):
+    session = session_factory()
+    clock = Clock()
+    service = LocalLifecycleService(session_factory, {}, clock=clock)
+    # Rows from before the upgrade have never been retrieved
+    ids = {
+        add(session, "old page", "https://old.example", START, CONVERSATION),
+        add(session, "old note", "user input", START, CONVERSATION),
+    }
+    clock.advance(400)
+    result = asyncio.run(service.run_once())
+    assert {memory.id for memory in session_factory().query(Memory)} == ids
+    assert (result.expired, result.evicted, result.archived) == (0, 0, 0)
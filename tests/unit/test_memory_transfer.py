@@ -0,0 +1,221 @@
+import asyncio
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.MemoryTransfer import (  # noqa: E402
+    decode_embedding,
+    embedding_model_fingerprint,
+    encode_embedding,
+    export_ndjson,
+    import_ndjson,
+    iter_ndjson,
+)
+
+DIMENSIONS = 384
+FINGERPRINT = {"id": "local-model", "name": "test-model", "dimensions": DIMENSIONS}
+OTHER_MODEL = {"id": "other-model", "name": "other", "dimensions": 768}
+CONVERSATION = "6f1c1f0e-2d7c-4d47-9e0b-6a3f1f1a0b11"
+
+
+def synthetic_rows(count, dimensions=DIMENSIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        vector = rng.standard_normal(dimensions).astype(np.float32)
+        yield SimpleNamespace(
+            conversation_id=CONVERSATION if i % 3 == 0 else None,
+            text=f"memory {i} about topic {i % 17}",
+            description=f"description {i}",
+            external_source="file notes.md" if i % 2 else "user input",
+            additional_metadata=f"meta {i}",
+            timestamp=start + timedelta(minutes=i),
+            embedding=vector / np.linalg.norm(vector),
+        )
+
+
+async def rechunk(lines, size=4096):
+    """Feed the export through arbitrary chunk boundaries like an HTTP body"""
+    buffer = b""
+    for line in lines:
+        buffer += line
+        while len(buffer) >= size:
+            yield buffer[:size]
+            buffer = buffer[size:]
+    if buffer:
+        yield buffer
+
+
+class Sink:
+    def __init__(self, keep=True):
+        self.keep = keep
+        self.rows = []
+        self.count = 0
+        self.embed_calls = []
+
+    def insert(self, rows):
+        self.count += len(rows)
+        if self.keep:
+            self.rows.extend(rows)
+
+    def embed(self, texts):
+        self.embed_calls.append(len(texts))
+        return [np.full(DIMENSIONS, 0.5, dtype=np.float32) for _ in texts]
+
+
+def run_import(lines, sink, fingerprint=FINGERPRINT, **kwargs):
+    return asyncio.run(
+        import_ndjson(
+            iter_ndjson(rechunk(lines)),
+            fingerprint=fingerprint,
+            insert_rows=sink.insert,
+            embed_texts=sink.embed,
+            **kwargs,
+        )
+    )
+
+
+def test_embedding_encoding_is_exact():
+    vector = np.random.default_rng(1).standard_normal(DIMENSIONS).astype(np.float32)
+    assert np.array_equal(decode_embedding(encode_embedding(vector)), vector)
+    assert np.array_equal(decode_embedding(vector.tolist()), vector)
+    assert encode_embedding(None) is None
+
+
+def test_round_trip_keeps_vectors_and_metadata():
+    source = list(synthetic_rows(1200))
+    sink = Sink()
+
+    report = run_import(
+        export_ndjson(iter(source), FINGERPRINT, agent_name="AGiXT"), sink
+    )
+
+    assert report.model_match and report.complete
+    assert report.imported == 1200 and report.reembedded == 0
+    assert sink.embed_calls == []
+    for original, row in zip(source, sink.rows):
+        assert row["text"] == original.text
+        assert row["description"] == original.description
+        assert row["external_source"] == original.external_source
+        assert row["additional_metadata"] == original.additional_metadata
+        assert row["timestamp"] == original.timestamp
+        assert row["conversation_id"] == original.conversation_id
+        assert np.array_equal(row["embedding"], original.embedding)
+
+
+def test_model_mismatch_reembeds_in_batches():
+    sink = Sink()
+    report = run_import(
+        export_ndjson(synthetic_rows(1200), OTHER_MODEL), sink, batch_size=500
+    )
+
+    assert not report.model_match
+    assert report.source_model["id"] == "other-model"
+    assert report.reembedded == report.imported == 1200
+    assert sink.embed_calls == [500, 500, 200]
+    assert all(float(row["embedding"][0]) == 0.5 for row in sink.rows)
+
+
+def test_bad_vectors_are_reembedded_individually():
+    rows = list(synthetic_rows(3))
+    rows[1].embedding = np.ones(10, dtype=np.float32)
+    rows[2].embedding = None
+    sink = Sink()
+
+    report = run_import(export_ndjson(rows, FINGERPRINT), sink)
+
+    assert report.imported == 3 and report.reembedded == 2
+    assert sink.embed_calls == [2]
+    assert "10 dimensions" in report.errors[0]
+
+
+def test_unknown_collections_are_skipped():
+    def resolve(collection):
+        if collection == "0":
+            return None
+        raise LookupError(f"Conversation {collection} not found")
+
+    sink = Sink()
+    report = run_import(
+        export_ndjson(synthetic_rows(30), FINGERPRINT),
+        sink,
+        resolve_collection=resolve,
+    )
+
+    assert report.imported == 20 and report.skipped == 10
+    assert report.complete
+    assert report.errors == [f"Conversation {CONVERSATION} not found"]
+    assert all(row["conversation_id"] is None for row in sink.rows)
+
+
+def test_rejects_streams_that_are_not_exports():
+    with pytest.raises(ValueError, match="missing header"):
+        run_import([b'{"type": "memory", "text": "x"}\n'], Sink())
+    with pytest.raises(ValueError, match="not valid JSON"):
+        run_import(
+            [next(export_ndjson([], FINGERPRINT)), b"{truncated\n"],
+            Sink(),
+        )
+
+
+def test_truncated_export_is_reported():
+    lines = list(export_ndjson(synthetic_rows(5), FINGERPRINT))[:-1]
+    report = run_import(lines, Sink())
+    assert report.imported == 5
+    assert not report.complete
+    assert "no footer" in report.errors[-1]
+
+
+def test_fingerprint_tracks_model_files(tmp_path):
+    (tmp_path / "config.json").write_text(
+        '{"_name_or_path": "sentence-transformers/all-MiniLM-L6-v2", "hidden_size": 384}'
+    )
+    (tmp_path / "model.onnx").write_bytes(b"weights-v1")
+    first = embedding_model_fingerprint(str(tmp_path))
+    assert first["dimensions"] == 384
+    assert first == embedding_model_fingerprint(str(tmp_path))
+
+    (tmp_path / "model.onnx").write_bytes(b"weights-v2-retrained")
+    assert embedding_model_fingerprint(str(tmp_path))["id"] != first["id"]
+
+
+def test_streaming_memory_stays_bounded():
+    rows = 20_000
+    exported_bytes = 0
+
+    def counted(lines):
+        nonlocal exported_bytes
+        for line in lines:
+            exported_bytes += len(line)
+            yield line
+
+    sink = Sink(keep=False)
+    tracemalloc.start()
+    try:
+        report = run_import(
+            counted(export_ndjson(synthetic_rows(rows), FINGERPRINT)), sink
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert report.imported == sink.count == rows and report.complete
+    # The stream is ~45 MB; only one batch is ever held in memory
+    assert exported_bytes > 40 * 1024 * 1024
+    assert peak < 8 * 1024 * 1024
+    print(
+        f"\n{rows} memories, {exported_bytes / 1e6:.0f} MB streamed, "
+        f"peak traced memory {peak / 1e6:.1f} MB"
+    )
@@ -0,0 +1,153 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+BENCHMARKS = os.path.join(PROJECT_ROOT, "tests", "benchmarks")
+if BENCHMARKS not in sys.path:
+    sys.path.insert(0, BENCHMARKS)
+
+from agixt import Reranker as reranker_module  # noqa: E402
+from agixt.Reranker import (  # noqa: E402
+    CrossEncoderScorer,
+    LexicalScorer,
+    Reranker,
+    RerankResult,
+    select_within_budget,
+)
+from retrieval_eval import evaluate, get_reranker  # noqa: E402
+
+QUERY = "How long do we keep WAL segments?"
+CANDIDATES = [
+    ("deploy", "Roll out the api service with helm upgrade and watch the pods."),
+    ("billing", "Stripe webhook failures mean the signing secret was rotated."),
+    ("wal", "Backups keep fourteen days of WAL segments for point in time recovery."),
+    ("standup", "Standup moved to 9:30 on Tuesdays."),
+]
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+
+class CountingScorer:
+    name = "counting"
+    cacheable = True
+    blend_with_prior = False
+
+    def __init__(self):
+        self.scored = []
+
+    def __call__(self, query, texts):
+        self.scored.append(list(texts))
+        return [float("WAL" in text) + len(text) / 1000 for text in texts]
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def test_lexical_fallback_promotes_matches_without_discarding_prior_order():
+    scores = LexicalScorer()(QUERY, [text for _, text in CANDIDATES])
+    assert scores[2] == max(scores) and scores[0] == 0.0
+    identifiers = LexicalScorer()(
+        "ERR_CONN_RESET", ["saw err_conn_reset twice", "connection reset by peer"]
+    )
+    assert identifiers[0] > 0 and identifiers[1] == 0
+
+    reranker = Reranker(scorer=LexicalScorer(), cache=LocalCache())
+    results = reranker.rerank(QUERY, CANDIDATES)
+    assert [result.key for result in results] == ["wal", "deploy", "billing", "standup"]
+    assert [result.prior_rank for result in results] == [2, 0, 1, 3]
+
+
+def test_budgeted_selection_skips_what_does_not_fit():
+    texts = {"a": "one two three", "b": "x " * 50, "c": "four five", "d": "six"}
+    ranked = [RerankResult(key=key, score=0.0, prior_rank=0) for key in texts]
+    picked = select_within_budget(
+        ranked, texts, token_budget=6, count_tokens=word_count
+    )
+    assert [result.key for result in picked] == ["a", "c", "d"]
+    assert [result.tokens for result in picked] == [3, 2, 1]
+    assert [
+        result.key
+        for result in select_within_budget(ranked, texts, limit=2, count_tokens=len)
+    ] == ["a", "b"]
+
+    reranker = Reranker(
+        scorer=CountingScorer(), cache=LocalCache(), count_tokens=word_count
+    )
+    results = reranker.rerank(QUERY, CANDIDATES, limit=3, token_budget=20)
+    assert results[0].key == "wal"
+    assert sum(result.tokens for result in results) <= 20
+
+
+def test_scores_are_cached_per_query_and_memory():
+    scorer = CountingScorer()
+    cache = LocalCache()
+    reranker = Reranker(scorer=scorer, cache=cache)
+    first = reranker.rerank(QUERY, CANDIDATES, limit=2)
+    assert [result.key for result in first] == ["wal", "deploy"]
+    # Same question, one new candidate: only the new one is scored
+    again = reranker.rerank(
+        QUERY + "  ", CANDIDATES + [("new", "WAL archiving is on")], limit=2
+    )
+    assert scorer.scored[1] == ["WAL archiving is on"]
+    assert [result.key for result in again] == ["wal", "new"]
+    assert reranker.stats["cache_hits"] == len(CANDIDATES)
+    reranker.rerank("A different question", CANDIDATES)
+    assert len(scorer.scored[2]) == len(CANDIDATES)
+
+
+def test_failing_model_falls_back_to_lexical(monkeypatch):
+    class BrokenScorer(CountingScorer):
+        def __call__(self, query, texts):
+            raise RuntimeError("model file is corrupt")
+
+    reranker = Reranker(scorer=BrokenScorer(), cache=LocalCache())
+    results = reranker.rerank(QUERY, CANDIDATES, limit=1)
+    assert [result.key for result in results] == ["wal"]
+    assert reranker.stats["fallbacks"] == 1
+    # Without an installed model the lexical scorer is used from the start
+    monkeypatch.setattr(reranker_module, "RERANKER_MODEL_DIR", "/nonexistent")
+    assert Reranker(cache=LocalCache()).scorer.name == "lexical"
+
+
+def test_onnx_cross_encoder_ranks_pairs(tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tokenizers")
+    from rerank_benchmark import make_tiny_cross_encoder
+
+    make_tiny_cross_encoder(str(tmp_path))
+    scorer = CrossEncoderScorer(model_dir=str(tmp_path), batch_size=3)
+    assert scorer.available and scorer.name.startswith("cross-encoder:")
+    scores = scorer(
+        "wal segments retention", ["wal segments retention", "helm upgrade pods"]
+    )
+    assert scores[0] > scores[1]
+    texts = [text for _, text in CANDIDATES]
+    # Length-sorted batches of 3 give the same scores as one at a time
+    one_by_one = [scorer(QUERY, [text])[0] for text in texts]
+    assert scorer(QUERY, texts) == pytest.approx(one_by_one, abs=1e-5)
+
+
+def test_eval_harness_rerank_mode():
+    report = evaluate(embedder="hashing", reranker=get_reranker())
+    assert set(report) == {"vector", "lexical", "hybrid", "hybrid+rerank"}
+    reranked = report["hybrid+rerank"]
+    assert reranked["mrr"] >= report["hybrid"]["mrr"]
+    assert reranked["recall@5_by_kind"]["exact"] == 1.0
@@ -0,0 +1,276 @@
+import os
+import re
+import sys
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.CodeIndex import CodeIndex  # noqa: E402
+from agixt.SemanticCodeIndex import (  # noqa: E402
+    SemanticCodeIndex,
+    chunk_source,
+    expand_query_terms,
+)
+
+# Concept groups give the stand-in model a little "semantic" knowledge, so a
+# query about "signing in" lands near code that talks about passwords.
+CONCEPTS = [
+    {"login", "password", "credential", "signin", "sign", "authenticate", "hash"},
+    {"invoice", "billing", "payment", "charge", "price", "amount", "tax"},
+    {"resize", "image", "thumbnail", "pixel", "width", "height", "picture"},
+    {"retry", "backoff", "attempt", "sleep", "transient", "flaky"},
+    {"email", "smtp", "send", "message", "recipient", "mail"},
+]
+
+
+class HashingEmbedder:
+    """Deterministic local stand-in for the ONNX embedder."""
+
+    dimensions = 256
+
+    def __init__(self):
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _features(self, text):
+        words = re.findall(r"[A-Za-z][a-z]*", text)
+        for word in (w.lower() for w in words):
+            yield f"w:{word}"
+            for i, concept in enumerate(CONCEPTS):
+                if word in concept:
+                    yield f"c:{i}"
+                    yield f"c:{i}"
+
+    def __call__(self, texts):
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                vectors[row, zlib.crc32(feature.encode()) % self.dimensions] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+FIXTURE_FILES = {
+    "app/accounts.py": '''
+import bcrypt
+
+
+def verify_user_password(user, password):
+    """Check a plain text password against the stored bcrypt hash."""
+    return bcrypt.checkpw(password.encode(), user.password_hash)
+
+
+def create_account(email, password):
+    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return {"email": email, "password_hash": hashed}
+''',
+    "app/billing.py": '''
+TAX_RATE = 0.2
+
+
+def compute_invoice_total(line_items):
+    """Sum line item amounts and add tax to produce the invoice total."""
+    subtotal = sum(item["amount"] for item in line_items)
+    return round(subtotal * (1 + TAX_RATE), 2)
+
+
+def charge_customer(customer, amount):
+    return customer.payment_method.charge(amount)
+''',
+    "app/images.py": '''
+from PIL import Image
+
+
+def make_thumbnail(path, width=128, height=128):
+    """Resize an image to thumbnail dimensions keeping the aspect ratio."""
+    picture = Image.open(path)
+    picture.thumbnail((width, height))
+    return picture
+''',
+    "app/net.py": '''
+import time
+
+
+def with_retries(fn, attempts=5, backoff=0.5):
+    """Call fn, retrying transient failures with exponential backoff."""
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except ConnectionError:
+            time.sleep(backoff * (2 ** attempt))
+    raise RuntimeError("gave up")
+''',
+    "web/mailer.js": """
+export function sendWelcomeEmail(recipient) {
+  const message = buildMessage(recipient);
+  return smtp.send(message);
+}
+
+function buildMessage(recipient) {
+  return { to: recipient, subject: "Welcome" };
+}
+""",
+}
+
+# (query, expected file, expected symbol)
+LABELLED_QUERIES = [
+    (
+        "where do we check the password when a user signs in",
+        "app/accounts.py",
+        "verify_user_password",
+    ),
+    ("calculate the price including tax", "app/billing.py", "compute_invoice_total"),
+    ("shrink a picture", "app/images.py", "make_thumbnail"),
+    ("handle flaky network calls", "app/net.py", "with_retries"),
+    ("mail a new user", "web/mailer.js", "sendWelcomeEmail"),
+]
+
+
+@pytest.fixture
+def fixture_repo(tmp_path):
+    root = str(tmp_path)
+    for rel_path, content in FIXTURE_FILES.items():
+        full_path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(content.lstrip("\n"))
+    return root
+
+
+def make_index(root, embedder=None):
+    embedder = embedder or HashingEmbedder()
+    return SemanticCodeIndex(root, embedder=embedder, code_index=CodeIndex(root))
+
+
+def test_chunk_source_splits_on_definitions():
+    chunks = chunk_source("app/billing.py", FIXTURE_FILES["app/billing.py"].lstrip())
+    names = [c.name for c in chunks]
+    assert "compute_invoice_total" in names
+    assert "charge_customer" in names
+    total = next(c for c in chunks if c.name == "compute_invoice_total")
+    assert total.text.startswith("def compute_invoice_total")
+    assert total.start_line == 4
+
+
+def test_chunk_source_splits_large_classes_into_methods():
+    methods = "".join(
+        f"    def method_{i}(self):\n" + "        x = 1\n" * 20 for i in range(6)
+    )
+    chunks = chunk_source("big.py", "class Big:\n    '''Doc.'''\n" + methods)
+    assert [c.kind for c in chunks].count("method") == 6
+    assert chunks[0].kind == "class"
+    assert chunks[0].end_line == 2
+
+
+def test_labelled_queries_retrieve_expected_chunk(fixture_repo):
+    index = make_index(fixture_repo)
+    hits_at_1 = 0
+    for query, expected_file, expected_symbol in LABELLED_QUERIES:
+        hits = index.search(query, max_results=3)
+        top = [(h.chunk.rel_path, h.chunk.name) for h in hits]
+        assert (expected_file, expected_symbol) in top, (query, top)
+        hits_at_1 += top[0] == (expected_file, expected_symbol)
+    assert hits_at_1 / len(LABELLED_QUERIES) >= 0.8
+
+
+def test_only_changed_chunks_are_re_embedded(fixture_repo):
+    embedder = HashingEmbedder()
+    index = make_index(fixture_repo, embedder)
+    index.refresh()
+    initial = index.get_stats()
+    assert initial["vectors"] == initial["chunks"]
+
+    index.refresh()
+    assert index.get_stats()["chunks_embedded"] == initial["chunks_embedded"]
+
+    path = os.path.join(fixture_repo, "app/net.py")
+    with open(path, "a") as f:
+        f.write("\n\ndef jitter(value):\n    return value * 1.1\n")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    index.refresh()
+    # Only the new function chunk is new content
+    assert index.get_stats()["chunks_embedded"] == initial["chunks_embedded"] + 1
+
+
+def test_keyword_fallback_when_embedder_fails(fixture_repo):
+    def broken_embedder(texts):
+        raise FileNotFoundError("onnx/model.onnx")
+
+    index = make_index(fixture_repo, broken_embedder)
+    hits = index.search("invoice total")
+    assert index.get_stats()["embedding_error"]
+    assert hits[0].chunk.name == "compute_invoice_total"
+
+
+def test_embedder_is_retried_after_a_failure(fixture_repo, monkeypatch):
+    import agixt.SemanticCodeIndex as semantic_module
+
+    embedder = HashingEmbedder()
+    failing = {"on": True}
+
+    def flaky_embedder(texts):
+        if failing["on"]:
+            raise TimeoutError("embedding service unavailable")
+        return embedder(texts)
+
+    index = make_index(fixture_repo, flaky_embedder)
+    index.search("invoice total")
+    assert index.get_stats()["embedding_error"]
+
+    failing["on"] = False
+    # Within the backoff the index stays keyword-only
+    index.search("invoice total")
+    assert index.get_stats()["embedding_error"] and embedder.calls == 0
+
+    monkeypatch.setattr(semantic_module, "EMBEDDING_RETRY_SECONDS", 0)
+    hits = index.search("signing in with a password")
+    stats = index.get_stats()
+    assert stats["embedding_error"] is None
+    assert stats["vectors"] == stats["chunks"] > 0
+    assert hits[0].vector_score > 0
+
+
+def test_expand_query_terms_adds_synonyms():
+    terms = expand_query_terms("auth errors")
+    assert "login" in terms and "jwt" in terms
+    assert terms.count("auth") == 1
+
+
+def test_index_build_time_on_generated_repo(tmp_path):
+    root = str(tmp_path)
+    for i in range(300):
+        os.makedirs(os.path.join(root, f"pkg{i % 10}"), exist_ok=True)
+        with open(os.path.join(root, f"pkg{i % 10}", f"mod_{i}.py"), "w") as f:
+            for j in range(10):
+                f.write(
+                    f"def handler_{i}_{j}(request):\n    return request.id + {j}\n\n"
+                )
+    embedder = HashingEmbedder()
+    index = make_index(root, embedder)
+    start = time.perf_counter()
+    index.refresh()
+    build_seconds = time.perf_counter() - start
+    stats = index.get_stats()
+    assert stats["chunks"] == 3000
+    # Batched: one embedder call per 32 chunks rather than one per chunk
+    assert embedder.calls == -(-stats["chunks_embedded"] // 32)
+    print(
+        f"\nBuilt semantic index for {stats['chunks']} chunks in {build_seconds:.2f}s"
+    )
+
+    start = time.perf_counter()
+    index.refresh()
+    assert time.perf_counter() - start < build_seconds
@@ -0,0 +1,287 @@
+import asyncio
+import io
+import os
+import random
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.SpeechStream import (  # noqa: E402
+    BatchSTTStream,
+    EnergyEndpointer,
+    SpeculativeTurn,
+    STTProvider,
+    STTStream,
+    StreamingTranscriber,
+    frame_energy,
+    parse_sample_rate,
+    pcm_to_wav,
+)
+
+RATE = 16000
+FRAME = RATE * 20 // 1000 * 2
+SCRIPT = "turn on the living room lights please".split()
+
+
+def silence(seconds, rng):
+    return rng.normal(0, 60, int(RATE * seconds))
+
+
+def word(seconds, rng):
+    t = np.arange(int(RATE * seconds)) / RATE
+    pitch = rng.uniform(110, 220)
+    voiced = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 5))
+    envelope = np.minimum(1, np.minimum(t, t[-1] - t) / 0.02)
+    return 4000 * voiced * envelope + rng.normal(0, 60, t.size)
+
+
+def utterance_pcm(words=SCRIPT, lead=0.5, tail=1.0, seed=3):
+    """A recording of one spoken utterance: voiced words with short gaps."""
+    rng = np.random.default_rng(seed)
+    parts = [silence(lead, rng)]
+    for index, _ in enumerate(words):
+        if index:
+            parts.append(silence(rng.uniform(0.08, 0.14), rng))
+        parts.append(word(rng.uniform(0.18, 0.3), rng))
+    parts.append(silence(tail, rng))
+    samples = np.clip(np.concatenate(parts), -32768, 32767)
+    return samples.astype("<i2").tobytes()
+
+
+def recognize(pcm, words=SCRIPT):
+    """Fake recognizer: one word of the script per voiced run heard."""
+    runs, voiced, gap = 0, False, 0
+    for start in range(0, len(pcm) - FRAME + 1, FRAME):
+        if frame_energy(pcm[start : start + FRAME]) >= 500:
+            runs += 0 if voiced else 1
+            voiced, gap = True, 0
+        else:
+            gap += 1
+            voiced = voiced and gap < 2
+    return " ".join(words[:runs])
+
+
+class FakeBatchSTT(STTProvider):
+    """Batch endpoint that takes longer for longer audio."""
+
+    def __init__(self, words=SCRIPT, base=0.02, per_second=0.01):
+        self.words = words
+        self.base = base
+        self.per_second = per_second
+        self.requests = 0
+
+    async def transcribe(self, audio, filename="audio.wav", content_type="audio/wav"):
+        self.requests += 1
+        with wave.open(io.BytesIO(audio)) as wav:
+            assert wav.getframerate() == RATE and wav.getsampwidth() == 2
+            pcm = wav.readframes(wav.getnframes())
+        await asyncio.sleep(self.base + self.per_second * len(pcm) / 2 / RATE)
+        return recognize(pcm, self.words)
+
+
+class FakeStreamingSTT(STTProvider):
+    """Streaming provider: a hypothesis after every 100ms of audio."""
+
+    streaming = True
+
+    def __init__(self, words):
+        self.words = words
+
+    def open_stream(self, sample_rate, on_partial=None):
+        return FakeStream(sample_rate, on_partial, self.words)
+
+
+class FakeStream(STTStream):
+    def __init__(self, sample_rate, on_partial, words):
+        super().__init__(sample_rate, on_partial)
+        self.words = words
+        self.audio = bytearray()
+
+    async def send(self, pcm, voiced=True):
+        before = len(self.audio) // 3200
+        self.audio.extend(pcm)
+        if len(self.audio) // 3200 > before:
+            await self._report(recognize(bytes(self.audio), self.words))
+
+    async def finish(self):
+        return recognize(bytes(self.audio), self.words)
+
+
+async def feed_in_frames(transcriber, pcm, frame=640, realtime=False):
+    for start in range(0, len(pcm), frame):
+        await transcriber.feed(pcm[start : start + frame])
+        if realtime:
+            await asyncio.sleep(frame / 2 / RATE)
+
+
+def test_endpointer_finds_each_utterance_with_preroll():
+    rng = np.random.default_rng(1)
+    first = utterance_pcm(seed=1)
+    quiet_noise = (rng.normal(0, 120, RATE)).astype("<i2").tobytes()
+    second = utterance_pcm(["lights", "off"], seed=2)
+    endpointer = EnergyEndpointer(sample_rate=RATE)
+    events = []
+    audio = first + quiet_noise + second
+    # Odd-sized network chunks are re-framed
+    chunks = random.Random(4)
+    position = 0
+    while position < len(audio):
+        size = chunks.randint(100, 3000)
+        events.extend(endpointer.feed(audio[position : position + size]))
+        position += size
+    kinds = [event.kind for event in events if event.kind != "audio"]
+    assert kinds == ["start", "end", "start", "end"]
+
+    start = events[0]
+    # Preroll of silence before the first voiced frames
+    assert len(start.audio) >= FRAME * 10
+    assert frame_energy(start.audio[:FRAME]) < 500
+
+    # Words inside an utterance are not split by the short gaps between them
+    first_utterance = events[: [e.kind for e in events].index("end")]
+    assert sum(1 for e in first_utterance if e.kind == "audio" and not e.voiced) > 0
+
+    endpointer.feed(utterance_pcm(["stop"], tail=0.1))
+    assert endpointer.in_speech
+    assert [event.kind for event in endpointer.flush()] == ["end"]
+    assert endpointer.flush() == []
+
+
+def test_unsupported_sample_rates_are_rejected():
+    assert parse_sample_rate(None) == 16000
+    assert parse_sample_rate("8000") == 8000 and parse_sample_rate(48000) == 48000
+    for value in (10, 49, -16000, 0, 96000, "fast", [16000]):
+        with pytest.raises(ValueError):
+            parse_sample_rate(value)
+    # A rate too low for one sample per frame would make feed() spin forever
+    with pytest.raises(ValueError):
+        EnergyEndpointer(sample_rate=10)
+
+
+def test_batch_fallback_streams_partials_and_reuses_the_pause_partial():
+    async def scenario():
+        provider = FakeBatchSTT()
+        partials, finals = [], []
+
+        async def on_partial(text, stable):
+            partials.append((text, stable))
+
+        async def on_final(text, speech_ended_at):
+            finals.append(text)
+
+        transcriber = StreamingTranscriber(
+            provider, on_partial=on_partial, on_final=on_final, sample_rate=RATE
+        )
+        await feed_in_frames(transcriber, utterance_pcm(), realtime=True)
+        await transcriber.join()
+
+        assert finals == [" ".join(SCRIPT)]
+        # Growing hypotheses while speaking, the full one marked stable
+        assert len(partials) >= 2
+        assert partials[0][0] != finals[0] and not partials[0][1]
+        assert partials[-1] == (finals[0], True)
+        stats = transcriber.get_stats()
+        assert stats["utterances"] == 1 and stats["stable_partials"] >= 1
+        # The final transcript is the pause partial, not another request
+        assert provider.requests == len(partials)
+
+    asyncio.run(scenario())
+
+
+def test_batch_stream_transcribes_when_no_partial_covers_the_speech():
+    async def scenario():
+        provider = FakeBatchSTT(["hello", "there"])
+        stream = BatchSTTStream(provider, RATE, partial_interval=0)
+        pcm = utterance_pcm(["hello", "there"], tail=0.05)
+        for start in range(0, len(pcm), FRAME):
+            frame = pcm[start : start + FRAME]
+            await stream.send(frame, frame_energy(frame) >= 500)
+        assert await stream.finish() == "hello there"
+        assert provider.requests == 1 and not stream.reused_partial
+
+    asyncio.run(scenario())
+
+
+def test_streaming_provider_contract_and_ordered_finals():
+    async def scenario():
+        partials, finals = [], []
+
+        async def on_partial(text, stable):
+            partials.append((text, stable))
+
+        async def on_final(text, speech_ended_at):
+            finals.append(text)
+            events.append("final")
+
+        async def on_speech_end():
+            events.append("end")
+
+        # Words of both utterances; each stream recognizes from its own audio
+        words = ["what", "time", "is", "it"]
+        events = []
+        transcriber = StreamingTranscriber(
+            FakeStreamingSTT(words),
+            on_partial=on_partial,
+            on_final=on_final,
+            on_speech_end=on_speech_end,
+            sample_rate=RATE,
+        )
+        pcm = utterance_pcm(words, seed=5) + utterance_pcm(["what"], seed=6)
+        await feed_in_frames(transcriber, pcm)
+        await transcriber.join()
+        assert finals == ["what time is it", "what"]
+        # Speech end is reported before its transcript is back
+        assert events.count("end") == 2 and events[0] == "end"
+        assert all(
+            events[:index].count("end") > events[:index].count("final")
+            for index, event in enumerate(events)
+            if event == "final"
+        )
+        # Repeated hypotheses become stable
+        assert ("what time is it", True) in partials
+        assert not transcriber.in_speech
+
+    asyncio.run(scenario())
+
+
+def test_speculative_turn_keeps_matching_work_and_cancels_the_rest():
+    async def scenario():
+        speculation = SpeculativeTurn()
+        started = []
+
+        def factory(text):
+            started.append(text)
+            return {"category": asyncio.ensure_future(asyncio.sleep(10))}
+
+        assert speculation.start("Turn on the lights", factory)
+        # Same hypothesis again does not restart the work
+        assert not speculation.start("turn on the lights.", factory)
+        task = speculation.take("Turn on the lights!")["category"]
+        assert not task.cancelled()
+        task.cancel()
+
+        speculation.start("turn on the", factory)
+        stale = speculation.tasks["category"]
+        assert speculation.take("turn on the kitchen lights") == {}
+        await asyncio.sleep(0)
+        assert stale.cancelled()
+        assert speculation.get_stats() == {"hits": 1, "misses": 1, "pending": False}
+        assert started == ["Turn on the lights", "turn on the"]
+
+    asyncio.run(scenario())
+
+
+def test_pcm_to_wav_round_trip():
+    pcm = utterance_pcm(["hi"], lead=0.1, tail=0.1)
+    with wave.open(io.BytesIO(pcm_to_wav(pcm, RATE))) as wav:
+        assert (wav.getnchannels(), wav.getframerate()) == (1, RATE)
+        assert wav.readframes(wav.getnframes()) == pcm
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import struct
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.SpeechSynthesis import (  # noqa: E402
+    AudioCache,
+    TTSProvider,
+    TTSScheduler,
+    unframe_pcm,
+)
+
+
+class FakeTTS(TTSProvider):
+    """Waits before the first chunk, then streams a few chunks per sentence."""
+
+    def __init__(self, first_chunk=0.05, chunk_delay=0.01, chunks=3):
+        self.first_chunk = first_chunk
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self.cancelled = 0
+
+    async def synthesize(self, text, voice, language, audio_format):
+        self.calls.append(text)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            if text == "broken":
+                raise RuntimeError("voice server error")
+            await asyncio.sleep(self.first_chunk)
+            for index in range(self.chunks):
+                yield f"{text}|{index};".encode()
+                await asyncio.sleep(self.chunk_delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+
+class Client:
+    """Records what a voice client would receive, in order."""
+
+    def __init__(self, playback=0.0):
+        self.playback = playback
+        self.received = []
+
+    async def play(self, item, chunks):
+        audio = b""
+        async for chunk in chunks:
+            audio += chunk
+            await asyncio.sleep(self.playback)
+        self.received.append((item.text, audio))
+
+
+def test_sentences_play_in_order_while_the_next_ones_synthesize():
+    async def scenario():
+        provider = FakeTTS()
+        client = Client()
+        scheduler = TTSScheduler(provider, client.play, ahead=2)
+        sentences = [f"Sentence number {i}." for i in range(6)]
+        started = time.perf_counter()
+        items = [scheduler.enqueue(text) for text in sentences]
+        await scheduler.drain()
+        elapsed = time.perf_counter() - started
+
+        assert [text for text, _ in client.received] == sentences
+        for text, audio in client.received:
+            assert audio == b"".join(f"{text}|{i};".encode() for i in range(3))
+        # The playing sentence plus two ahead, never more
+        assert provider.peak == 3
+        # One synthesis after another would take 6 x 80ms
+        assert elapsed < 6 * 0.08 * 0.7
+        assert all([await scheduler.wait(item) for item in items])
+        stats = scheduler.get_stats()
+        assert stats["played"] == 6 and stats["pending"] == 0
+        stages = stats["stages"]
+        assert stages["synth_first_chunk"]["p50"] >= 45
+        # Later sentences were ready before their turn
+        assert stages["gap_between_sentences"]["p50"] < 30
+
+    asyncio.run(scenario())
+
+
+def test_barge_in_cancels_playback_and_pending_synthesis():
+    async def scenario():
+        provider = FakeTTS(first_chunk=0.05, chunk_delay=0.05, chunks=4)
+        client = Client()
+        scheduler = TTSScheduler(provider, client.play, ahead=2)
+        items = [scheduler.enqueue(f"Part {i}.") for i in range(5)]
+        await asyncio.sleep(0.08)
+        assert scheduler.cancel() == 5
+        await asyncio.sleep(0.01)
+
+        assert client.received == []
+        assert provider.active == 0 and provider.cancelled == 3
+        # Sentences beyond the prefetch window were never synthesized
+        assert provider.calls == ["Part 0.", "Part 1.", "Part 2."]
+        assert not any([await scheduler.wait(item) for item in items])
+        assert scheduler.get_stats()["cancelled"] == 5
+
+        # The next turn speaks normally
+        item = scheduler.enqueue("New answer.")
+        assert await scheduler.wait(item)
+        assert [text for text, _ in client.received] == ["New answer."]
+
+    asyncio.run(scenario())
+
+
+def test_failed_sentence_does_not_stall_the_queue():
+    async def scenario():
+        client = Client()
+        scheduler = TTSScheduler(FakeTTS(first_chunk=0.01), client.play)
+        failed = scheduler.enqueue("broken")
+        after = scheduler.enqueue("Still here.")
+        await scheduler.drain()
+        assert failed.failed and not after.failed
+        assert [text for text, _ in client.received] == ["broken", "Still here."]
+        assert client.received[0][1] == b""
+        assert scheduler.get_stats()["failed"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_recurring_phrases_come_from_memory_then_disk(tmp_path):
+    async def scenario():
+        provider = FakeTTS(first_chunk=0.05)
+        cache = AudioCache(directory=str(tmp_path), max_text=40)
+        client = Client()
+        scheduler = TTSScheduler(provider, client.play, cache=cache)
+        ack = "Sure, checking that now."
+        long_answer = "This sentence is too long to be worth caching at all."
+        for text in [ack, long_answer, ack, ack]:
+            await scheduler.wait(scheduler.enqueue(text))
+        await asyncio.sleep(0.01)
+        assert provider.calls == [ack, long_answer]
+        assert len({audio for text, audio in client.received if text == ack}) == 1
+        hit = scheduler._history[-1]
+        assert hit.cached and hit.timings()["synth_first_chunk"] < 20
+        stats = scheduler.get_stats()
+        assert (stats["cache_hits"], stats["cache_misses"]) == (2, 1)
+        assert stats["cache_hit_rate"] == 0.667
+
+        # Another process (or a restart) reads the same phrase from disk,
+        # and the voice is part of the key
+        restarted = AudioCache(directory=str(tmp_path), max_text=40)
+        scheduler = TTSScheduler(provider, client.play, cache=restarted)
+        await scheduler.wait(scheduler.enqueue(ack))
+        await scheduler.wait(scheduler.enqueue(ack, voice="other"))
+        assert provider.calls == [ack, long_answer, ack]
+        assert restarted.get_stats()["disk_hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cached_wav_is_replayed_as_one_blob(tmp_path):
+    class WavTTS(TTSProvider):
+        async def synthesize(self, text, voice, language, audio_format):
+            yield b"RIFF" + b"\0" * 10000
+
+    async def scenario():
+        chunks = []
+
+        async def play(item, audio):
+            chunks.append([chunk async for chunk in audio])
+
+        cache = AudioCache(directory=str(tmp_path))
+        scheduler = TTSScheduler(WavTTS(), play, cache=cache)
+        for _ in range(2):
+            await scheduler.wait(scheduler.enqueue("One moment.", audio_format="wav"))
+        assert scheduler._history[-1].cached
+        # A WAV sentence is one complete file, from the provider or the cache
+        assert [len(sent) for sent in chunks] == [1, 1]
+        assert chunks[0] == chunks[1]
+
+        await scheduler.wait(scheduler.enqueue("One moment.", audio_format="pcm"))
+        await scheduler.wait(scheduler.enqueue("One moment.", audio_format="pcm"))
+        assert len(chunks[-1]) == 3
+
+    asyncio.run(scenario())
+
+
+def test_audio_cache_bounds_memory_and_disk(tmp_path):
+    cache = AudioCache(directory=str(tmp_path), memory_bytes=250, disk_bytes=300)
+    keys = [cache.key(f"phrase {i}", "default", "en", "pcm") for i in range(4)]
+    for key in keys:
+        cache.set(key, b"x" * 100)
+    stats = cache.get_stats()
+    assert stats["memory_entries"] == 2 and stats["memory_bytes"] == 200
+    assert stats["disk_entries"] == 3 and stats["disk_bytes"] == 300
+    assert len(os.listdir(tmp_path)) == 3
+    # Oldest entry was evicted everywhere; the others are served from disk
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) == b"x" * 100
+    assert cache.get_stats()["disk_hits"] == 1
+    assert cache.key("a", "v1", "en", "pcm") != cache.key("a", "v2", "en", "pcm")
+
+
+def test_unframe_pcm_strips_length_prefixes_and_passes_raw_audio():
+    async def chunks(data, size):
+        for start in range(0, len(data), size):
+            yield data[start : start + size]
+
+    async def collect(data, size):
+        return b"".join([chunk async for chunk in unframe_pcm(chunks(data, size))])
+
+    frames = [b"\x01\x02" * 50, b"\x03\x04" * 80]
+    framed = b"".join(struct.pack("<I", len(f)) + f for f in frames)
+    assert asyncio.run(collect(framed, 7)) == b"".join(frames)
+    raw = b"\xff\xff\xff\x7f" + b"\x00" * 100
+    assert asyncio.run(collect(raw, 16)) == raw
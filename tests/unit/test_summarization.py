@@ -0,0 +1,157 @@
+import asyncio
+import os
+import re
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.Summarization import MapReduceSummarizer, split_by_tokens  # noqa: E402
+
+PADDING = 40
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class LocalCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+
+class FakeProvider:
+    """
+    Summarizes any text to "[first-last]" of the paragraph numbers it covers
+    plus fixed padding, finishing later calls first to shake out ordering bugs.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, text, stage):
+        self.calls.append(stage)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        numbers = [int(n) for n in re.findall(r"\d+", text)]
+        await asyncio.sleep(0.001 * (50 - numbers[0]) / 10)
+        self.in_flight -= 1
+        return f"[{numbers[0]}-{numbers[-1]}]" + " x" * PADDING
+
+
+def document(paragraphs=16, words=50):
+    return "\n\n".join(
+        f"p{index} " + " ".join(["word"] * (words - 1)) for index in range(paragraphs)
+    )
+
+
+def summarizer(provider, cache, concurrency=4):
+    return MapReduceSummarizer(
+        summarize=provider,
+        count_tokens=count_words,
+        chunk_size=100,
+        concurrency=concurrency,
+        cache=cache,
+        cache_namespace="test",
+    )
+
+
+def markers(summary):
+    return re.findall(r"\[\d+-\d+\]", summary)
+
+
+def test_split_by_tokens_keeps_order_and_splits_long_paragraphs():
+    chunks = split_by_tokens(document(paragraphs=5), 100, count_words)
+    assert [re.findall(r"p\d+", chunk) for chunk in chunks] == [
+        ["p0", "p1"],
+        ["p2", "p3"],
+        ["p4"],
+    ]
+    long_paragraph = " ".join(f"w{i}" for i in range(250))
+    pieces = split_by_tokens(long_paragraph, 100, count_words)
+    assert [count_words(piece) for piece in pieces] == [100, 100, 50]
+    assert " ".join(pieces) == long_paragraph
+
+
+def test_map_keeps_document_order():
+    provider = FakeProvider()
+    result = asyncio.run(
+        summarizer(provider, LocalCache()).run(document(), token_budget=10_000)
+    )
+    assert markers(result.summary) == [f"[{i}-{i + 1}]" for i in range(0, 16, 2)]
+    assert result.chunks == 8 and result.levels == 0
+    assert provider.calls == ["map"] * 8
+
+
+def test_hierarchical_reduce_until_within_budget():
+    provider = FakeProvider()
+    result = asyncio.run(
+        summarizer(provider, LocalCache()).run(document(), token_budget=50)
+    )
+    # 8 partial summaries of 41 words reduce in pairs: 8 -> 4 -> 2 -> 1
+    assert markers(result.summary) == ["[0-15]"]
+    assert result.levels == 3
+    assert provider.calls == ["map"] * 8 + ["reduce"] * 7
+    usage = result.usage
+    assert usage.calls == 15 and usage.cache_hits == 0
+    assert usage.input_tokens == 16 * 50 + 7 * 2 * (PADDING + 1)
+    assert usage.output_tokens == 15 * (PADDING + 1)
+
+
+def test_bounded_concurrency():
+    provider = FakeProvider()
+    asyncio.run(
+        summarizer(provider, LocalCache(), concurrency=3).run(
+            document(paragraphs=32), token_budget=10_000
+        )
+    )
+    assert provider.max_in_flight == 3
+
+
+def test_partial_summaries_are_reused_across_runs():
+    cache = LocalCache()
+    first = FakeProvider()
+    asyncio.run(summarizer(first, cache).run(document(), token_budget=50))
+
+    again = FakeProvider()
+    result = asyncio.run(summarizer(again, cache).run(document(), token_budget=50))
+    assert again.calls == []
+    assert result.usage.cache_hits == 15
+    assert result.usage.cached_input_tokens == 16 * 50 + 7 * 2 * (PADDING + 1)
+    assert markers(result.summary) == ["[0-15]"]
+
+    # Editing one paragraph only re-summarizes its chunk; the fake gives the
+    # same partial summary back, so every reduce above it is still cached
+    edited = document().replace("p5 word", "p5 changed", 1)
+    changed = FakeProvider()
+    result = asyncio.run(summarizer(changed, cache).run(edited, token_budget=50))
+    assert changed.calls == ["map"]
+    assert result.usage.cache_hits == 14
+
+
+def test_stops_when_summary_cannot_shrink():
+    async def stubborn(text, stage):
+        return "same " * 60
+
+    result = asyncio.run(
+        MapReduceSummarizer(
+            summarize=stubborn,
+            count_tokens=count_words,
+            chunk_size=100,
+            cache=LocalCache(),
+        ).run("short text", token_budget=10)
+    )
+    assert count_words(result.summary) == 60
+    assert result.levels == 1 and result.usage.calls == 2
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers, UploadFile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.Uploads import (  # noqa: E402
+    UPLOAD_INDEX_FILE,
+    find_duplicate,
+    forget_upload,
+    is_reserved_upload_name,
+    receive_upload,
+    remember_upload,
+)
+
+
+def body(size, seed=7):
+    block = hashlib.sha256(str(seed).encode()).digest() * 2048
+    return (block * (size // len(block) + 1))[:size]
+
+
+async def network(data, chunk=65536):
+    for start in range(0, len(data), chunk):
+        await asyncio.sleep(0)
+        yield data[start : start + chunk]
+
+
+class FakeRequest:
+    """The parts of a Starlette Request that receive_upload reads."""
+
+    def __init__(self, data, headers=None):
+        self.data = data
+        self.headers = Headers(headers or {})
+        self.consumed = 0
+
+    async def stream(self):
+        async for chunk in network(self.data):
+            self.consumed += len(chunk)
+            yield chunk
+
+
+def test_small_upload_stays_in_memory_and_is_hashed(tmp_path):
+    async def scenario():
+        data = body(200_000)
+        upload = await receive_upload(
+            network(data, chunk=1000), filename="notes.txt", spool_dir=str(tmp_path)
+        )
+        assert upload.in_memory and upload.size == len(data)
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        assert upload.file.read() == data
+        assert await upload.read() == data
+        path = await upload.save(str(tmp_path / "docs" / "notes.txt"))
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert sorted(os.listdir(tmp_path / "docs")) == ["notes.txt"]
+
+    asyncio.run(scenario())
+
+
+def test_large_upload_spools_to_disk_and_is_moved_into_place(tmp_path):
+    async def scenario():
+        data = body(5 * 1024 * 1024 + 123)
+        request = FakeRequest(data, {"content-type": "application/pdf"})
+        spool = tmp_path / "spool"
+        upload = await receive_upload(request, spool_bytes=1024 * 1024, spool_dir=spool)
+        assert not upload.in_memory
+        assert upload.content_type == "application/pdf"
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        # Downstream processors read the handle from the start
+        assert upload.file.read(4) == data[:4]
+        spooled = os.stat(upload.spool_path)
+        path = await upload.save(str(tmp_path / "report.pdf"))
+        assert os.stat(path).st_ino == spooled.st_ino
+        assert os.listdir(spool) == []
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+    asyncio.run(scenario())
+
+
+def test_size_limit_is_enforced_while_streaming(tmp_path):
+    async def scenario():
+        spool = tmp_path / "spool"
+        # No Content-Length: stops as soon as the limit is crossed
+        request = FakeRequest(body(4 * 1024 * 1024))
+        with pytest.raises(HTTPException) as error:
+            await receive_upload(
+                request, max_bytes=2 * 1024 * 1024, spool_bytes=1024, spool_dir=spool
+            )
+        assert error.value.status_code == 413
+        assert request.consumed <= 2 * 1024 * 1024 + 65536
+        assert os.listdir(spool) == []
+
+        # Declared too large: rejected before the body is read
+        request = FakeRequest(body(10), {"content-length": str(3 * 1024 * 1024)})
+        with pytest.raises(HTTPException):
+            await receive_upload(request, max_bytes=2 * 1024 * 1024, spool_dir=spool)
+        assert request.consumed == 0
+
+    asyncio.run(scenario())
+
+
+def test_upload_file_from_a_multipart_form(tmp_path):
+    async def scenario():
+        data = body(3 * 1024 * 1024)
+        form_file = UploadFile(
+            io.BytesIO(data),
+            size=len(data),
+            filename="meeting.wav",
+            headers=Headers({"content-type": "audio/wav"}),
+        )
+        upload = await receive_upload(
+            form_file, spool_bytes=1024 * 1024, spool_dir=tmp_path
+        )
+        assert (upload.filename, upload.content_type) == ("meeting.wav", "audio/wav")
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        upload.close()
+        assert os.listdir(tmp_path) == []
+
+        with pytest.raises(HTTPException):
+            await receive_upload(form_file, max_bytes=1024 * 1024)
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_content_is_found_by_hash(tmp_path):
+    async def scenario():
+        directory = str(tmp_path / "collection")
+        data = body(1000)
+        first = await receive_upload(network(data))
+        await first.save(os.path.join(directory, "a.txt"))
+        assert await find_duplicate(directory, first.sha256) is None
+        await remember_upload(directory, first.sha256, "a.txt")
+
+        again = await receive_upload(network(data))
+        assert await find_duplicate(directory, again.sha256) == "a.txt"
+        other = await receive_upload(network(body(1000, seed=8)))
+        assert await find_duplicate(directory, other.sha256) is None
+        # A removed file no longer counts as stored
+        os.remove(os.path.join(directory, "a.txt"))
+        assert await find_duplicate(directory, again.sha256) is None
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_must_still_hold_the_content(tmp_path):
+    async def scenario():
+        directory = str(tmp_path / "collection")
+        original, revised = body(1000), body(1000, seed=9)
+        first = await receive_upload(network(original))
+        await first.save(os.path.join(directory, "a.txt"))
+        await remember_upload(directory, first.sha256, "a.txt")
+
+        # A new version of a.txt replaces the content the index points at
+        second = await receive_upload(network(revised))
+        await second.save(os.path.join(directory, "a.txt"))
+        await remember_upload(directory, second.sha256, "a.txt")
+        assert await find_duplicate(directory, first.sha256) is None
+        assert await find_duplicate(directory, second.sha256) == "a.txt"
+
+        # Dropped once its memories are deleted
+        await forget_upload(directory, second.sha256)
+        assert await find_duplicate(directory, second.sha256) is None
+
+        # Indexes written before sizes were recorded are verified by hash
+        with open(os.path.join(directory, UPLOAD_INDEX_FILE), "w") as f:
+            json.dump({second.sha256: "a.txt", first.sha256: "a.txt"}, f)
+        assert await find_duplicate(directory, second.sha256) == "a.txt"
+        assert await find_duplicate(directory, first.sha256) is None
+
+        assert is_reserved_upload_name(UPLOAD_INDEX_FILE)
+        assert is_reserved_upload_name(f"{UPLOAD_INDEX_FILE}.123.part")
+        assert not is_reserved_upload_name("upload_hashes.json")
+
+    asyncio.run(scenario())
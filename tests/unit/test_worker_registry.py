@@ -0,0 +1,247 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+AGIXT_SRC = os.path.join(PROJECT_ROOT, "agixt")
+if AGIXT_SRC not in sys.path:
+    sys.path.insert(0, AGIXT_SRC)
+
+from agixt.SharedCache import Subscription  # noqa: E402
+import agixt.WorkerRegistry as worker_registry_module  # noqa: E402
+from agixt.WorkerRegistry import (  # noqa: E402
+    ACTIVE_CONVERSATIONS_KEY,
+    WorkerRegistry,
+)
+
+
+class SharedRedis:
+    """In-memory stand-in for the Redis that every worker's SharedCache uses."""
+
+    def __init__(self):
+        self.values = {}
+        self.subscriptions = []
+        self.drop_messages = False
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry and entry[1] and entry[1] <= time.time():
+            del self.values[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else default
+
+    def set(self, key, value, ttl=0):
+        with self._lock:
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+        return True
+
+    def set_if_not_exists(self, key, value, ttl=0):
+        with self._lock:
+            if self._live(key):
+                return False
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self.values.pop(key, None) is not None
+
+    def exists(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def set_field(self, key, field, value, ttl=0):
+        with self._lock:
+            entry = self._live(key) or ({}, None)
+            entry[0][field] = value
+            self.values[key] = (entry[0], time.time() + ttl if ttl else entry[1])
+        return True
+
+    def delete_field(self, key, field):
+        with self._lock:
+            entry = self._live(key)
+            return bool(entry) and entry[0].pop(field, None) is not None
+
+    def get_fields(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return dict(entry[0]) if entry else {}
+
+    def publish(self, channel, message):
+        if self.drop_messages:
+            return 0
+        with self._lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription._deliver(message)
+        return len(subscriptions)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, on_close=self._unsubscribe)
+        with self._lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions.remove(subscription)
+
+
+async def conversation(registry, conversation_id, user_id="user-1"):
+    """A streaming interaction: registers, checks is_stopped per token."""
+    registry.register_conversation(
+        conversation_id, user_id, "XT", task=asyncio.current_task()
+    )
+    try:
+        while not registry.is_stopped(conversation_id):
+            await asyncio.sleep(0.01)
+        return "stopped"
+    finally:
+        registry.unregister_conversation(conversation_id)
+
+
+def workers(redis, count=3, **kwargs):
+    return [
+        WorkerRegistry(cache=redis, worker_id=f"worker-{index}", **kwargs)
+        for index in range(count)
+    ]
+
+
+def test_stop_from_another_worker_reaches_the_owner():
+    async def scenario():
+        redis = SharedRedis()
+        owner, api, other = workers(redis)
+        running = asyncio.ensure_future(conversation(owner, "conv-1"))
+        await asyncio.sleep(0.05)
+
+        # Every worker lists it, with the worker that runs it
+        for registry in (owner, api, other):
+            listed = registry.get_user_conversations("user-1")
+            assert list(listed) == ["conv-1"]
+        assert api.get_conversation_info("conv-1")["worker_id"] == "worker-0"
+        assert api.get_active_count() == 1
+
+        started = time.perf_counter()
+        assert await api.stop_conversation("conv-1", user_id="user-1")
+        latency = time.perf_counter() - started
+        assert running.cancelled() or running.result() == "stopped"
+        # Pub/sub delivery, not the heartbeat interval
+        assert latency < 0.5, latency
+        assert owner.stats["stops_received"] == 1 and api.stats["stops_sent"] == 1
+        for registry in (owner, api, other):
+            assert registry.get_user_conversations("user-1") == {}
+        assert redis.get_fields(ACTIVE_CONVERSATIONS_KEY) == {}
+        for registry in (owner, api, other):
+            registry.close()
+
+    asyncio.run(scenario())
+
+
+def test_remote_stop_checks_the_user_and_unknown_conversations():
+    async def scenario():
+        redis = SharedRedis()
+        owner, api = workers(redis, 2)
+        running = asyncio.ensure_future(conversation(owner, "conv-2"))
+        await asyncio.sleep(0.05)
+        assert not await api.stop_conversation("conv-2", user_id="someone-else")
+        assert not await api.stop_conversation("missing", user_id="user-1")
+        await asyncio.sleep(0.05)
+        assert not running.done() and not owner.is_stopped("conv-2")
+
+        assert await api.stop_user_conversations("user-1") == 1
+        assert running.done()
+        owner.close()
+        api.close()
+
+    asyncio.run(scenario())
+
+
+def test_owner_that_missed_the_message_stops_at_its_heartbeat():
+    async def scenario():
+        redis = SharedRedis()
+        owner, api = workers(redis, 2)
+        running = asyncio.ensure_future(conversation(owner, "conv-3"))
+        await asyncio.sleep(0.05)
+        redis.drop_messages = True
+        # The stop is recorded even though nobody heard it
+        stop = asyncio.ensure_future(api.stop_conversation("conv-3"))
+        await asyncio.sleep(0.1)
+        assert not running.done()
+        owner.heartbeat()
+        assert await stop
+        assert running.done()
+        owner.close()
+        api.close()
+
+    asyncio.run(scenario())
+
+
+def test_stop_that_is_not_acknowledged_in_time_reports_failure(monkeypatch):
+    monkeypatch.setattr(worker_registry_module, "CONVERSATION_STOP_TIMEOUT", 0.1)
+
+    async def scenario():
+        redis = SharedRedis()
+        owner, api = workers(redis, 2)
+        running = asyncio.ensure_future(conversation(owner, "conv-6"))
+        await asyncio.sleep(0.05)
+        redis.drop_messages = True
+        assert not await api.stop_conversation("conv-6")
+        assert not running.done()
+        # The request is kept, so the owner still stops at its heartbeat
+        owner.heartbeat()
+        await asyncio.sleep(0.05)
+        assert running.done()
+        owner.close()
+        api.close()
+
+    asyncio.run(scenario())
+
+
+def test_entries_of_a_dead_worker_age_out_and_are_pruned_once():
+    async def scenario():
+        redis = SharedRedis()
+        dead, first, second = workers(redis, heartbeat_ttl=30)
+        dead.register_conversation("conv-4", "user-1", "XT")
+        dead.close()
+        assert list(first.get_user_conversations("user-1")) == ["conv-4"]
+
+        # No heartbeat for longer than the TTL
+        for key in (ACTIVE_CONVERSATIONS_KEY, "conversations_user:user-1"):
+            info = redis.get_fields(key)["conv-4"]
+            redis.set_field(key, "conv-4", {**info, "heartbeat_at": time.time() - 60})
+        # while the conversation's own key has expired
+        redis.delete("conversation_active:conv-4")
+        assert first.get_user_conversations("user-1") == {}
+        assert not await first.stop_conversation("conv-4")
+
+        assert first.cleanup_finished_conversations() == 1
+        # The other worker finds the prune lease taken
+        assert second.cleanup_finished_conversations() == 0
+        assert redis.get_fields(ACTIVE_CONVERSATIONS_KEY) == {}
+        assert redis.get_fields("conversations_user:user-1") == {}
+
+    asyncio.run(scenario())
+
+
+def test_without_a_shared_cache_the_registry_is_per_process():
+    async def scenario():
+        owner, api = WorkerRegistry(), WorkerRegistry()
+        running = asyncio.ensure_future(conversation(owner, "conv-5"))
+        await asyncio.sleep(0.02)
+        assert api.get_user_conversations("user-1") == {}
+        assert not await api.stop_conversation("conv-5")
+        assert await owner.stop_conversation("conv-5", user_id="user-1")
+        assert running.done() and owner.get_active_count() == 0
+        assert owner._listener is None
+
+    asyncio.run(scenario())